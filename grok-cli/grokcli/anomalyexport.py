@@ -0,0 +1,696 @@
+#!/usr/bin/env python
+#------------------------------------------------------------------------------
+# Copyright 2013-2014 Numenta Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#------------------------------------------------------------------------------
+
+"""Continuously export Grok metric values and anomaly scores to a third party
+monitoring system.
+
+Unlike `grokcli.datadog`, which re-downloads the most recent records of a
+single metric every time it runs, the exporter keeps a high-water mark per
+metric and only fetches records added since then. Records are fetched in the
+compact msgpack format, several metrics at a time, and pushed to a pluggable
+sink:
+
+  - DatadogSink: Datadog metric series API
+  - GraphiteSink: Graphite/Carbon plaintext protocol
+  - FileSink: local file with one JSON record per line
+
+Each metric is exported as two series: one for the values and one for the
+anomaly scores, transformed to match the height of the bars in the Grok mobile
+client (see `transformAnomalyScore`). Only records that already have an anomaly
+score are exported.
+
+High-water marks are advanced only after a sink accepts a metric's records and
+are saved to a file after every export cycle, so a restarted exporter resumes
+where it left off. Sink and Grok API failures are retried with exponential
+backoff; a metric that still fails is retried on the next cycle.
+
+Usage:
+
+    python -m grokcli.anomalyexport GROK_SERVER_URL GROK_API_KEY \\
+        --sink=datadog --datadog-api-key=KEY
+
+Note: This requires the `msgpack-python` library, which can be installed with
+the samples bundle: `pip install grokcli[samples]`.
+"""
+
+from collections import namedtuple
+import json
+import math
+import optparse
+import os
+import Queue
+import socket
+import sys
+import threading
+import time
+
+import msgpack
+import requests
+
+from grokcli.api import GrokSession
+from grokcli.exceptions import GrokCLIError
+
+
+
+# A Grok metric being exported
+# uid: Grok metric id
+# name: Grok metric name
+# server: name of the server (or other resource) the metric belongs to
+ExportedMetric = namedtuple("ExportedMetric", "uid name server")
+
+
+# A Grok metric data record
+# timestamp: unix timestamp in seconds
+# value: metric value
+# anomalyScore: anomaly score, as returned by the Grok API
+# rowid: per-metric row id; increases with timestamp
+MetricRecord = namedtuple("MetricRecord", "timestamp value anomalyScore rowid")
+
+
+# Result of AnomalyExporter.runOnce()
+# numMetrics: number of metrics exported successfully, including metrics
+#   without new records
+# numRecords: number of records exported
+# failedMetricIds: ids of metrics whose export failed
+ExportCycleStats = namedtuple("ExportCycleStats",
+                              "numMetrics numRecords failedMetricIds")
+
+
+
+def transformAnomalyScore(score):
+  """Transform anomaly score to match Grok mobile bar height.
+
+  :param score: the "anomaly_score" value returned by the Grok API
+  :return: the value corresponding to the height of the anomaly bars in Grok
+      mobile
+  """
+  if score > 0.99999:
+    return 1.0
+
+  return math.log(1.0000000001 - score) / math.log(1.0 - 0.9999999999)
+
+
+
+def _formatTimestamp(timestamp):
+  """ Format a unix timestamp for the `from` parameter of the metric data API
+  """
+  return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(timestamp))
+
+
+
+def retryWithBackoff(fn, maxRetries=5, initialDelaySec=1.0, maxDelaySec=60.0,
+                     retryExceptions=(Exception,), sleep=time.sleep):
+  """ Call `fn` until it succeeds, waiting exponentially longer between
+  attempts.
+
+  :param fn: function to call without arguments
+  :param maxRetries: maximum number of retries after the first attempt
+  :param initialDelaySec: delay before the first retry; doubled after every
+    retry
+  :param maxDelaySec: maximum delay between attempts
+  :param retryExceptions: exception classes that trigger a retry; others
+    propagate immediately
+  :param sleep: function used to wait between attempts
+  :returns: the return value of `fn`
+  :raises: the last exception raised by `fn` once retries are exhausted
+  """
+  delay = initialDelaySec
+  for attempt in xrange(maxRetries + 1):
+    try:
+      return fn()
+    except retryExceptions:
+      if attempt == maxRetries:
+        raise
+    sleep(delay)
+    delay = min(delay * 2, maxDelaySec)
+
+
+
+class WatermarkStore(object):
+  """ Persistent per-metric high-water marks: the timestamp and row id of the
+  last record exported for each metric.
+  """
+
+  def __init__(self, path=None):
+    """
+    :param path: path of the JSON file holding the watermarks; None to keep
+      them in memory only
+    """
+    self._path = path
+    self._lock = threading.Lock()
+    self._watermarks = {}
+
+    if path is not None and os.path.exists(path):
+      with open(path, "r") as f:
+        self._watermarks = json.load(f)
+
+
+  def get(self, metricId):
+    """ :returns: (timestamp, rowid) of the last record exported for the
+    metric; None if nothing was exported yet
+    """
+    with self._lock:
+      watermark = self._watermarks.get(metricId)
+
+    if watermark is None:
+      return None
+
+    return watermark["timestamp"], watermark["rowid"]
+
+
+  def set(self, metricId, timestamp, rowid):
+    with self._lock:
+      self._watermarks[metricId] = {"timestamp": timestamp, "rowid": rowid}
+
+
+  def save(self):
+    """ Atomically save the watermarks """
+    if self._path is None:
+      return
+
+    with self._lock:
+      data = json.dumps(self._watermarks)
+
+    tempPath = self._path + ".tmp"
+    with open(tempPath, "w") as f:
+      f.write(data)
+    os.rename(tempPath, self._path)
+
+
+
+class DatadogSink(object):
+  """ Pushes records to the Datadog metric series API; the Grok metric server
+  is used as the Datadog host.
+  """
+
+  DEFAULT_URL = "https://app.datadoghq.com/api/v1/series"
+
+
+  def __init__(self, apiKey, url=DEFAULT_URL, timeout=30):
+    self._apiKey = apiKey
+    self._url = url
+    self._timeout = timeout
+
+
+  def send(self, metric, records):
+    valuePoints = [[record.timestamp, record.value] for record in records]
+    scorePoints = [[record.timestamp,
+                    transformAnomalyScore(record.anomalyScore)]
+                   for record in records]
+
+    series = [
+      {"metric": metric.name + ".value", "points": valuePoints,
+       "host": metric.server, "type": "gauge"},
+      {"metric": metric.name + ".anomalyScore", "points": scorePoints,
+       "host": metric.server, "type": "gauge"}]
+
+    response = requests.post(self._url,
+                             params={"api_key": self._apiKey},
+                             data=json.dumps({"series": series}),
+                             headers={"Content-Type": "application/json"},
+                             timeout=self._timeout)
+
+    if response.status_code not in (200, 202):
+      raise GrokCLIError("Datadog upload failed with status %d: %s"
+                         % (response.status_code, response.text))
+
+
+  def close(self):
+    pass
+
+
+
+class GraphiteSink(object):
+  """ Pushes records over the Graphite/Carbon plaintext protocol using a
+  persistent connection, which is re-established after failures.
+  """
+
+  DEFAULT_PORT = 2003
+
+
+  def __init__(self, host, port=DEFAULT_PORT, prefix="grok", timeout=30):
+    self._address = (host, port)
+    self._prefix = prefix
+    self._timeout = timeout
+    self._lock = threading.Lock()
+    self._sock = None
+
+
+  def _metricPath(self, metric, suffix):
+    parts = [self._prefix, metric.server, metric.name, suffix]
+    return ".".join(
+      "".join(c if c.isalnum() or c in "-_" else "_" for c in part)
+      for part in parts if part)
+
+
+  def send(self, metric, records):
+    valuePath = self._metricPath(metric, "value")
+    scorePath = self._metricPath(metric, "anomalyScore")
+
+    lines = []
+    for record in records:
+      lines.append("%s %r %d\n" % (valuePath, float(record.value),
+                                   record.timestamp))
+      lines.append("%s %r %d\n" % (scorePath,
+                                   transformAnomalyScore(record.anomalyScore),
+                                   record.timestamp))
+
+    with self._lock:
+      try:
+        if self._sock is None:
+          self._sock = socket.create_connection(self._address, self._timeout)
+        self._sock.sendall("".join(lines))
+      except socket.error:
+        self._closeSocket()
+        raise
+
+
+  def _closeSocket(self):
+    if self._sock is not None:
+      try:
+        self._sock.close()
+      finally:
+        self._sock = None
+
+
+  def close(self):
+    with self._lock:
+      self._closeSocket()
+
+
+
+class FileSink(object):
+  """ Appends records to a local file, one JSON object per line """
+
+  def __init__(self, path):
+    self._lock = threading.Lock()
+    self._fp = open(path, "a")
+
+
+  def send(self, metric, records):
+    lines = "".join(
+      json.dumps({"uid": metric.uid,
+                  "metric": metric.name,
+                  "server": metric.server,
+                  "timestamp": record.timestamp,
+                  "value": record.value,
+                  "anomalyScore": record.anomalyScore}) + "\n"
+      for record in records)
+
+    with self._lock:
+      self._fp.write(lines)
+      self._fp.flush()
+
+
+  def close(self):
+    with self._lock:
+      self._fp.close()
+
+
+
+class AnomalyExporter(object):
+  """ Incrementally exports the data of many Grok metrics to a sink.
+
+  ::
+
+      sink = GraphiteSink("graphite.example.com")
+      exporter = AnomalyExporter("https://grok.example.com", "apikey", sink,
+                                 watermarkPath="watermarks.json")
+      exporter.run()
+  """
+
+  _STOP = object()
+
+
+  def __init__(self, server, apikey, sink, metricIds=None, watermarkPath=None,
+               concurrency=4, pollIntervalSec=300, initialRecords=6,
+               batchSize=1000, maxRetries=5, retryDelaySec=1.0,
+               progressStream=sys.stderr):
+    """
+    :param server: Grok server URL
+    :param apikey: Grok API key
+    :param sink: object with `send(metric, records)` and `close()` methods;
+      `send` must raise if the records were not accepted
+    :param metricIds: ids of the metrics to export; None to export all models
+    :param watermarkPath: path of the file holding the per-metric high-water
+      marks; None to keep them in memory only
+    :param concurrency: number of metrics exported concurrently
+    :param pollIntervalSec: interval between export cycles of `run()`
+    :param initialRecords: number of most recent records to export for a
+      metric without a high-water mark; 0 to export all of its records
+    :param batchSize: maximum number of records fetched per request
+    :param maxRetries: maximum number of retries of a failed Grok API request
+      or sink push before giving up on the metric until the next cycle
+    :param retryDelaySec: delay before the first retry; doubled after every
+      retry
+    :param progressStream: file-like object for progress reports, or None
+    """
+    if concurrency < 1:
+      raise ValueError("concurrency must be positive")
+    if batchSize < 1:
+      raise ValueError("batchSize must be positive")
+
+    self._server = server
+    self._apikey = apikey
+    self._sink = sink
+    self._metricIds = set(metricIds) if metricIds else None
+    self._watermarks = WatermarkStore(watermarkPath)
+    self._concurrency = concurrency
+    self._pollIntervalSec = pollIntervalSec
+    self._initialRecords = initialRecords
+    self._batchSize = batchSize
+    self._maxRetries = maxRetries
+    self._retryDelaySec = retryDelaySec
+    self._progressStream = progressStream
+
+    self._stopEvent = threading.Event()
+    self._sessions = threading.local()
+
+
+  def getWatermark(self, metricId):
+    """ :returns: (timestamp, rowid) of the last record exported for the
+    metric; None if nothing was exported yet
+    """
+    return self._watermarks.get(metricId)
+
+
+  def close(self):
+    """ Close the sink """
+    self._sink.close()
+
+
+  def stop(self):
+    """ Ask `run()` to return after the current export cycle """
+    self._stopEvent.set()
+
+
+  def run(self):
+    """ Export new records every `pollIntervalSec` seconds until `stop()` is
+    called
+    """
+    try:
+      while not self._stopEvent.is_set():
+        startTime = time.time()
+        try:
+          self.runOnce()
+        except GrokCLIError as e:
+          self._log("Export cycle failed: %s" % (e,))
+
+        self._stopEvent.wait(
+          max(0, self._pollIntervalSec - (time.time() - startTime)))
+    finally:
+      self.close()
+
+
+  def runOnce(self):
+    """ Export the records added to each metric since its high-water mark
+
+    :returns: ExportCycleStats
+    """
+    metrics = self._retry(self._listMetrics)
+
+    lock = threading.Lock()
+    metricQueue = Queue.Queue()
+    numRecords = [0]
+    failedMetricIds = []
+
+    for metric in metrics:
+      metricQueue.put(metric)
+
+    def worker():
+      while True:
+        metric = metricQueue.get()
+        if metric is self._STOP:
+          return
+
+        try:
+          count = self._exportMetric(metric)
+        except Exception as e: # pylint: disable=W0703
+          self._log("Failed to export metric %s (%s): %s"
+                    % (metric.uid, metric.name, e))
+          with lock:
+            failedMetricIds.append(metric.uid)
+        else:
+          with lock:
+            numRecords[0] += count
+
+    for _ in xrange(self._concurrency):
+      metricQueue.put(self._STOP)
+
+    threads = [threading.Thread(target=worker)
+               for _ in xrange(self._concurrency)]
+    for thread in threads:
+      thread.setDaemon(True)
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    self._watermarks.save()
+
+    stats = ExportCycleStats(numMetrics=len(metrics) - len(failedMetricIds),
+                             numRecords=numRecords[0],
+                             failedMetricIds=failedMetricIds)
+    self._log("Exported %d records of %d metrics (%d failed)"
+              % (stats.numRecords, stats.numMetrics,
+                 len(stats.failedMetricIds)))
+    return stats
+
+
+  def _getSession(self):
+    """ :returns: this thread's GrokSession """
+    session = getattr(self._sessions, "session", None)
+    if session is None:
+      session = self._sessions.session = GrokSession(server=self._server,
+                                                     apikey=self._apikey)
+    return session
+
+
+  def _retry(self, fn):
+    return retryWithBackoff(fn, maxRetries=self._maxRetries,
+                            initialDelaySec=self._retryDelaySec,
+                            retryExceptions=(GrokCLIError,
+                                             requests.RequestException,
+                                             socket.error,
+                                             IOError))
+
+
+  def _listMetrics(self):
+    """ :returns: ExportedMetric for each metric to export """
+    models = self._getSession().listModels()
+    return [ExportedMetric(uid=model["uid"],
+                           name=model.get("name") or model["uid"],
+                           server=model.get("server"))
+            for model in models
+            if self._metricIds is None or model["uid"] in self._metricIds]
+
+
+  def _exportMetric(self, metric):
+    """ Export the new records of a metric in batches, advancing its
+    high-water mark after each batch is accepted by the sink
+
+    :returns: number of records exported
+    """
+    watermark = self._watermarks.get(metric.uid)
+    count = 0
+
+    if watermark is None and self._initialRecords:
+      # First export of this metric: start with its most recent records
+      records = self._retry(lambda: self._fetchRecords(
+        metric.uid, limit=self._initialRecords))
+      records.sort(key=lambda record: record.rowid)
+      if not records:
+        return 0
+      self._pushRecords(metric, records)
+      count += len(records)
+      watermark = self._watermarks.get(metric.uid)
+    elif watermark is None:
+      # First export of this metric: export all of its records
+      watermark = (0, -1)
+
+    while True:
+      timestamp, rowid = watermark
+      # `from` is inclusive, so records sharing the watermark's timestamp are
+      # fetched again; drop those already exported by row id
+      records = self._retry(lambda: self._fetchRecords(
+        metric.uid, fromTimestamp=timestamp, limit=self._batchSize))
+      numFetched = len(records)
+      records = [record for record in records if record.rowid > rowid]
+      if not records:
+        return count
+
+      self._pushRecords(metric, records)
+      count += len(records)
+
+      if numFetched < self._batchSize:
+        return count
+      watermark = self._watermarks.get(metric.uid)
+
+
+  def _pushRecords(self, metric, records):
+    self._retry(lambda: self._sink.send(metric, records))
+    last = records[-1]
+    self._watermarks.set(metric.uid, last.timestamp, last.rowid)
+
+
+  def _fetchRecords(self, metricId, fromTimestamp=None, limit=0):
+    """ Fetch scored records of a metric in msgpack format
+
+    :param metricId: Grok metric id
+    :param fromTimestamp: unix timestamp of the first record to fetch; None to
+      fetch the most recent records
+    :param limit: maximum number of records; 0 for no limit
+    :returns: list of MetricRecord; in ascending timestamp order when
+      fromTimestamp is given, descending otherwise
+    """
+    session = self._getSession()
+    # NOTE: `limit` isn't sent to the server, since the msgpack flavor of the
+    # API used to fail right after sending its header when given a limit,
+    # which would look like a metric without new records. Instead, the
+    # response stream is closed once enough records have been read.
+    params = {"anomaly": 0}
+    if fromTimestamp is not None:
+      params["from"] = _formatTimestamp(fromTimestamp)
+
+    response = session.get(
+      self._server + "/_models/" + metricId + "/data",
+      params=params,
+      headers={"Accept": "application/octet-stream"},
+      auth=session.auth,
+      stream=True)
+
+    if response.status_code != 200:
+      raise GrokCLIError("Unable to get data of metric %s.\nMessage: %s"
+                         % (metricId, response.text))
+
+    unpacker = msgpack.Unpacker()
+    records = []
+    header = None
+    try:
+      for chunk in response.iter_content(64 * 1024):
+        unpacker.feed(chunk)
+        for row in unpacker:
+          if header is None:
+            # The first object names the columns of the rows that follow
+            header = row
+            continue
+          _uid, timestamp, value, anomalyScore, rowid = row
+          records.append(MetricRecord(timestamp, value, anomalyScore, rowid))
+          if limit and len(records) >= limit:
+            return records
+    finally:
+      response.close()
+
+    return records
+
+
+  def _log(self, msg):
+    if self._progressStream is not None:
+      print >> self._progressStream, msg
+
+
+
+def _createSink(options, parser):
+  if options.sink == "datadog":
+    if not options.datadogApiKey:
+      parser.error("--datadog-api-key is required for the datadog sink")
+    return DatadogSink(options.datadogApiKey)
+
+  if options.sink == "graphite":
+    if not options.graphiteHost:
+      parser.error("--graphite-host is required for the graphite sink")
+    return GraphiteSink(options.graphiteHost, options.graphitePort,
+                        prefix=options.graphitePrefix)
+
+  if not options.output:
+    parser.error("--output is required for the file sink")
+  return FileSink(options.output)
+
+
+
+def main():
+  usage = "usage: %prog [options] GROK_SERVER_URL GROK_API_KEY"
+  parser = optparse.OptionParser(usage=usage)
+  parser.add_option("--sink", type="choice",
+                    choices=["datadog", "graphite", "file"], default="datadog",
+                    help="where to export to: datadog, graphite or file "
+                         "[default: %default]")
+  parser.add_option("--datadog-api-key", dest="datadogApiKey",
+                    help="the API key for Datadog")
+  parser.add_option("--graphite-host", dest="graphiteHost",
+                    help="the Graphite (Carbon) server hostname")
+  parser.add_option("--graphite-port", dest="graphitePort", type="int",
+                    default=GraphiteSink.DEFAULT_PORT,
+                    help="the Graphite (Carbon) plaintext port "
+                         "[default: %default]")
+  parser.add_option("--graphite-prefix", dest="graphitePrefix", default="grok",
+                    help="prefix of Graphite metric paths [default: %default]")
+  parser.add_option("--output", metavar="FILE",
+                    help="the output file for the file sink")
+  parser.add_option("--metric", dest="metricIds", action="append",
+                    metavar="METRIC_ID",
+                    help="export only this metric; may be repeated "
+                         "[default: all models]")
+  parser.add_option("--watermarks", dest="watermarkPath",
+                    default="grok-anomalyexport-watermarks.json",
+                    metavar="FILE",
+                    help="file holding the per-metric high-water marks "
+                         "[default: %default]")
+  parser.add_option("--interval", dest="pollIntervalSec", type="float",
+                    default=300,
+                    help="seconds between export cycles [default: %default]")
+  parser.add_option("--concurrency", type="int", default=4,
+                    help="number of metrics exported concurrently "
+                         "[default: %default]")
+  parser.add_option("--initial-records", dest="initialRecords", type="int",
+                    default=6,
+                    help="number of most recent records to export for a "
+                         "metric seen for the first time, or 0 for all "
+                         "[default: %default]")
+  parser.add_option("--once", action="store_true", default=False,
+                    help="run a single export cycle and exit")
+
+  options, args = parser.parse_args()
+
+  if len(args) != 2:
+    parser.error("incorrect number of arguments, expected 2 but got %i" %
+                 len(args))
+
+  exporter = AnomalyExporter(args[0], args[1], _createSink(options, parser),
+                             metricIds=options.metricIds,
+                             watermarkPath=options.watermarkPath,
+                             concurrency=options.concurrency,
+                             pollIntervalSec=options.pollIntervalSec,
+                             initialRecords=options.initialRecords)
+
+  if options.once:
+    try:
+      stats = exporter.runOnce()
+    finally:
+      exporter.close()
+    if stats.failedMetricIds:
+      sys.exit(1)
+    return
+
+  try:
+    exporter.run()
+  except KeyboardInterrupt:
+    pass
+
+
+
+if __name__ == "__main__":
+  main()
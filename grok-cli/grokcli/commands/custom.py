@@ -17,11 +17,13 @@
 import json
 from optparse import OptionParser
 import sys
+from urlparse import urlparse
 
 from prettytable import PrettyTable
 
 import grokcli
 from grokcli.api import GrokSession
+from grokcli import uploader
 from grokcli.exceptions import GrokCLIError
 
 
@@ -35,9 +37,11 @@ else:
 
 USAGE = """%s metrics (list|monitor|unmonitor) \
 [GROK_SERVER_URL GROK_API_KEY] [options]
+       %s upload FILE [GROK_SERVER_URL GROK_API_KEY] [options]
 
-Manage custom metrics.
-""".strip() % subCommand
+Manage custom metrics, or upload custom metric data in bulk from a CSV, TSV or
+gzip-compressed file of (metric, value, unix timestamp) rows.
+""".strip() % (subCommand, subCommand)
 
 parser = OptionParser(usage=USAGE)
 parser.add_option(
@@ -55,6 +59,44 @@ parser.add_option(
   dest="format",
   default="text",
   help='Output format (text|json)')
+parser.add_option(
+  "--port",
+  dest="port",
+  type="int",
+  default=uploader.DEFAULT_PORT,
+  help="Custom metric endpoint port (upload) [default: %default]")
+parser.add_option(
+  "--connections",
+  dest="connections",
+  type="int",
+  default=4,
+  help="Number of concurrent connections (upload) [default: %default]")
+parser.add_option(
+  "--batch-size",
+  dest="batchSize",
+  type="int",
+  default=1000,
+  help="Number of rows sent at a time per connection (upload) "
+       "[default: %default]")
+parser.add_option(
+  "--rate",
+  dest="rate",
+  type="float",
+  default=None,
+  help="Maximum upload rate in rows per second (upload) [default: unlimited]")
+parser.add_option(
+  "--checkpoint",
+  dest="checkpoint",
+  default=None,
+  metavar="PATH",
+  help="Checkpoint file for resuming an interrupted upload (upload) "
+       "[default: FILE.checkpoint]")
+parser.add_option(
+  "--restart",
+  dest="restart",
+  action="store_true",
+  default=False,
+  help="Ignore an existing checkpoint and upload from the beginning (upload)")
 
 
 
@@ -100,6 +142,21 @@ def handleUnmonitorRequest(grok, metricName):
   grok.deleteModel(metrics[0]["uid"])
 
 
+def handleUploadRequest(grok, path, options):
+  metricUploader = uploader.CustomMetricUploader(
+    host=urlparse(grok.server).hostname or grok.server,
+    port=options.port,
+    numConnections=options.connections,
+    batchSize=options.batchSize,
+    maxRowsPerSec=options.rate,
+    checkpointPath=options.checkpoint)
+
+  stats = metricUploader.upload(path, resume=not options.restart)
+
+  if options.format == "json":
+    print(json.dumps(stats._asdict()))
+
+
 def handle(options, args):
   """ `grok custom` handler. """
   try:
@@ -132,6 +189,10 @@ def handle(options, args):
     else:
       printHelpAndExit()
 
+  elif resource == "upload":
+    # For upload, the file path takes the place of the action
+    handleUploadRequest(grok, action, options)
+
   else:
     printHelpAndExit()
 
@@ -19,6 +19,8 @@ import sys
 from functools import partial
 from optparse import OptionParser
 from grokcli.api import GrokSession
+from grokcli.exceptions import GrokCLIError
+from grokcli.modeltransfer import ModelExporter
 import grokcli
 
 # Subcommand CLI Options
@@ -31,6 +33,9 @@ else:
 USAGE = """%s [GROK_SERVER_URL GROK_API_KEY]
 
 Export Grok model definitions.
+
+With --ndjson, model definitions are fetched --concurrency at a time and written
+one JSON object per line as they arrive, rather than as a single document.
 """.strip() % subCommand
 
 parser = OptionParser(usage=USAGE)
@@ -40,6 +45,20 @@ parser.add_option(
   dest="output",
   metavar="FILE",
   help="Write output to FILE instead of stdout")
+parser.add_option(
+  "-n",
+  "--ndjson",
+  dest="useNDJSON",
+  default=False,
+  action="store_true",
+  help="Stream results in NDJSON format, one model definition per line")
+parser.add_option(
+  "--concurrency",
+  dest="concurrency",
+  type="int",
+  default=4,
+  metavar="N",
+  help="Number of concurrent requests with --ndjson [default: %default]")
 try:
   import yaml
   parser.add_option(
@@ -72,6 +91,20 @@ def handle(options, args):
   else:
     outp = sys.stdout
 
+  if options.useNDJSON:
+    exporter = ModelExporter(grok.server, grok.apikey,
+                             concurrency=options.concurrency)
+    try:
+      stats = exporter.exportModels(outp)
+    finally:
+      if outp != sys.stdout:
+        outp.close()
+
+    if stats.failedModelIds:
+      raise GrokCLIError("%d models failed to export." % (
+        len(stats.failedModelIds),))
+    return
+
   models = grok.exportModels()
 
   if models:
@@ -18,11 +18,17 @@ try:
   import yaml
 except ImportError:
   import json # yaml not available, fall back to json
+import json
 import select
 import sys
 
 from functools import partial
 from grokcli.api import GrokSession
+from grokcli.exceptions import GrokCLIError
+from grokcli.modeltransfer import (
+  describeModelSpec,
+  iterModelSpecs,
+  ModelImporter)
 import grokcli
 from optparse import OptionParser
 
@@ -36,6 +42,13 @@ else:
 USAGE = """%s [GROK_SERVER_URL GROK_API_KEY] [FILE]
 
 Import Grok model definitions.
+
+FILE may hold a JSON or YAML document, or NDJSON (one JSON model definition per
+line, as written by `grok export --ndjson`), which is read incrementally.
+Models are created in chunks of --chunk-size definitions, --concurrency chunks
+at a time, and the outcome of each model is reported. Definitions of models
+that failed to import can be written to a file with --failed-output and
+imported again later.
 """.strip() % subCommand
 
 parser = OptionParser(usage=USAGE)
@@ -46,12 +59,58 @@ parser.add_option(
   metavar="FILE or -",
   help="Path to file containing Grok model definitions, or - if you " \
        "want to read the data from stdin.")
+parser.add_option(
+  "--chunk-size",
+  dest="chunkSize",
+  type="int",
+  default=100,
+  metavar="N",
+  help="Maximum number of model definitions per request [default: %default]")
+parser.add_option(
+  "--concurrency",
+  dest="concurrency",
+  type="int",
+  default=4,
+  metavar="N",
+  help="Number of concurrent requests [default: %default]")
+parser.add_option(
+  "--failed-output",
+  dest="failedOutput",
+  metavar="FILE",
+  help="Write the definitions of models that failed to import to FILE, in "
+       "NDJSON format, so that just those models can be imported again")
 
 # Implementation
 
-def importMetricsFromFile(grok, fp, **kwargs):
-  models = grokcli.load(fp.read())
-  result = grok.createModels(models)
+def _printResult(result):
+  if result.error is None:
+    print "%d\tOK\t%s\t%s" % (result.index, result.model.get("uid"),
+                               describeModelSpec(result.spec))
+  else:
+    print "%d\tFAILED\t%s\t%s" % (
+      result.index, describeModelSpec(result.spec),
+      " ".join(result.error.split()))
+  sys.stdout.flush()
+
+
+def importMetricsFromFile(grok, fp, chunkSize=100, concurrency=4,
+                          failedOutput=None, **kwargs):
+  importer = ModelImporter(grok.server, grok.apikey, chunkSize=chunkSize,
+                           concurrency=concurrency, onResult=_printResult)
+
+  stats = importer.importModels(iterModelSpecs(fp, load=grokcli.load))
+
+  if failedOutput is not None:
+    with open(failedOutput, "w") as outp:
+      for result in stats.failures:
+        outp.write(json.dumps(result.spec) + "\n")
+
+  if stats.failures:
+    message = "%d of %d models failed to import." % (
+      len(stats.failures), stats.numImported + len(stats.failures))
+    if failedOutput is not None:
+      message += " Their definitions were written to %s." % (failedOutput,)
+    raise GrokCLIError(message)
 
 
 def handle(options, args):
@@ -30,6 +30,9 @@ the Datadog metric name.
 Anomaly scores are transformed from what the Grok API returns into what is
 shown in the Grok mobile client as the height of the bars.
 
+To continuously export many metrics, fetching only new records each time, see
+`grokcli.anomalyexport`.
+
 Note: This sample requires the `dogapi` library, which can be installed with
 the samples bundle: `pip install grokcli[samples]`.
 """
@@ -0,0 +1,362 @@
+#------------------------------------------------------------------------------
+# Copyright 2013-2014 Numenta Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#------------------------------------------------------------------------------
+"""Streaming export and chunked, concurrent import of Grok model definitions.
+
+Model definitions may be exchanged as NDJSON: one JSON-encoded model
+definition per line. Unlike a single JSON or YAML document, NDJSON can be
+written as each model is exported and read back one model at a time, so memory
+use does not grow with the number of models.
+
+Import sends model definitions in chunks over several concurrent connections.
+When a chunk is rejected as a whole, its models are retried one at a time so
+that the outcome of each model can be reported. Creating a model for a metric
+that is already monitored returns the existing model, so it is safe to
+re-import definitions that were partially imported before.
+"""
+
+from collections import namedtuple
+import itertools
+import json
+import Queue
+import sys
+import threading
+
+from grokcli.api import GrokSession
+from grokcli.exceptions import GrokCLIError
+
+
+
+# Outcome of importing a single model definition
+# index: zero-based position of the model definition in the input
+# spec: the model definition
+# model: model returned by the server on success; None on failure
+# error: error message on failure; None on success
+ModelImportResult = namedtuple("ModelImportResult", "index spec model error")
+
+
+# Result of ModelImporter.importModels()
+# numImported: number of models created successfully
+# failures: sequence of ModelImportResult for the models that failed
+ImportStats = namedtuple("ImportStats", "numImported failures")
+
+
+# Result of ModelExporter.exportModels()
+# numExported: number of model definitions written
+# failedModelIds: sequence of ids of the models that could not be exported
+ExportStats = namedtuple("ExportStats", "numExported failedModelIds")
+
+
+
+def iterModelSpecs(fp, load=json.loads):
+  """ Iterate over the model definitions in a file.
+
+  NDJSON input is detected from its first non-blank line, which holds a
+  complete JSON object, and is read one line at a time. Any other input is
+  read in full and decoded with `load`; it may hold a single model definition
+  or a list of them.
+
+  :param fp: file-like object open for reading
+  :param load: function decoding a non-NDJSON document, e.g. `grokcli.load`
+  :returns: iterator over model definition dicts
+  """
+  for firstLine in fp:
+    if firstLine.strip():
+      break
+  else:
+    return
+
+  try:
+    firstSpec = json.loads(firstLine)
+  except ValueError:
+    firstSpec = None
+
+  if isinstance(firstSpec, dict):
+    yield firstSpec
+    for lineNum, line in enumerate(fp, start=2):
+      if not line.strip():
+        continue
+      try:
+        yield json.loads(line)
+      except ValueError as e:
+        raise GrokCLIError("Malformed model definition on line %d of NDJSON "
+                           "input: %s" % (lineNum, e))
+    return
+
+  specs = load(firstLine + fp.read())
+  if isinstance(specs, dict):
+    specs = [specs]
+  elif not isinstance(specs, list):
+    raise GrokCLIError("Expected a model definition or a list of model "
+                       "definitions")
+
+  for spec in specs:
+    yield spec
+
+
+
+def describeModelSpec(spec):
+  """ Short, human-readable description of a model definition for progress and
+  error reporting.
+  """
+  if not isinstance(spec, dict):
+    return repr(spec)
+
+  metricSpec = spec.get("metricSpec") or {}
+  parts = [spec.get("datasource"),
+           spec.get("metric") or metricSpec.get("metric"),
+           spec.get("resource") or metricSpec.get("resource")]
+
+  return " ".join(str(part) for part in parts if part) or "<unnamed>"
+
+
+
+class _SessionPool(threading.local):
+  """ One GrokSession per worker thread; requests sessions are not meant to be
+  shared between threads.
+  """
+
+  def __init__(self, server, apikey):
+    super(_SessionPool, self).__init__()
+    self.session = GrokSession(server=server, apikey=apikey)
+
+
+
+def _runWorkers(numWorkers, target):
+  threads = [threading.Thread(target=target) for _ in xrange(numWorkers)]
+  for thread in threads:
+    thread.setDaemon(True)
+    thread.start()
+  return threads
+
+
+
+class ModelImporter(object):
+  """ Creates models from a stream of model definitions, several chunks at a
+  time.
+  """
+
+  _STOP = object()
+
+
+  def __init__(self, server, apikey, chunkSize=100, concurrency=4,
+               onResult=None):
+    """
+    :param server: Grok server URL
+    :param apikey: Grok API key
+    :param chunkSize: maximum number of model definitions per request
+    :param concurrency: number of concurrent requests
+    :param onResult: optional function called with the ModelImportResult of
+      each model as soon as it is known; called from worker threads, one call
+      at a time
+    """
+    if chunkSize < 1:
+      raise ValueError("chunkSize must be positive")
+    if concurrency < 1:
+      raise ValueError("concurrency must be positive")
+
+    self._server = server
+    self._apikey = apikey
+    self._chunkSize = chunkSize
+    self._concurrency = concurrency
+    self._onResult = onResult
+
+    self._lock = threading.Lock()
+    self._numImported = 0
+    self._failures = []
+
+
+  def importModels(self, specs):
+    """ Import model definitions.
+
+    :param specs: iterable of model definition dicts; consumed lazily, so at
+      most a few chunks are held in memory at once
+    :returns: ImportStats; failures are ordered by their position in the input
+    """
+    self._numImported = 0
+    self._failures = []
+
+    sessions = _SessionPool(self._server, self._apikey)
+    chunkQueue = Queue.Queue(maxsize=self._concurrency * 2)
+
+    def worker():
+      while True:
+        item = chunkQueue.get()
+        if item is self._STOP:
+          return
+        self._importChunk(sessions.session, *item)
+
+    threads = _runWorkers(self._concurrency, worker)
+
+    try:
+      specs = iter(specs)
+      index = 0
+      while True:
+        chunk = list(itertools.islice(specs, self._chunkSize))
+        if not chunk:
+          break
+        chunkQueue.put((index, chunk))
+        index += len(chunk)
+    finally:
+      for _ in threads:
+        chunkQueue.put(self._STOP)
+      for thread in threads:
+        thread.join()
+
+    return ImportStats(numImported=self._numImported,
+                       failures=sorted(self._failures,
+                                       key=lambda result: result.index))
+
+
+  def _importChunk(self, session, startIndex, chunk):
+    try:
+      models = session.createModels(chunk)
+    except Exception: # pylint: disable=W0703
+      # E.g., GrokCLIError, or a connection error surfacing as some other
+      # exception from GrokSession
+      models = None
+
+    if not isinstance(models, list) or len(models) != len(chunk):
+      # The chunk was rejected as a whole (typically because one of its model
+      # definitions is invalid, or because of a connection error); fall back
+      # to one request per model so that each model gets its own outcome.
+      for index, spec in enumerate(chunk, start=startIndex):
+        self._importOne(session, index, spec)
+      return
+
+    for index, (spec, model) in enumerate(zip(chunk, models),
+                                          start=startIndex):
+      if isinstance(model, dict):
+        self._report(ModelImportResult(index, spec, model, None))
+      else:
+        # The server reports some per-model failures in place of the model
+        self._report(ModelImportResult(index, spec, None, unicode(model)))
+
+
+  def _importOne(self, session, index, spec):
+    try:
+      model = session.createModel(spec)
+    except Exception as e: # pylint: disable=W0703
+      self._report(ModelImportResult(index, spec, None,
+                                     unicode(e) or repr(e)))
+      return
+
+    if isinstance(model, list) and len(model) == 1:
+      model = model[0]
+
+    if isinstance(model, dict):
+      self._report(ModelImportResult(index, spec, model, None))
+    else:
+      self._report(ModelImportResult(index, spec, None, unicode(model)))
+
+
+  def _report(self, result):
+    with self._lock:
+      if result.error is None:
+        self._numImported += 1
+      else:
+        self._failures.append(result)
+
+      if self._onResult is not None:
+        self._onResult(result)
+
+
+
+class ModelExporter(object):
+  """ Exports model definitions as NDJSON, fetching several models at a time
+  and writing each definition as soon as it arrives.
+  """
+
+  _STOP = object()
+
+
+  def __init__(self, server, apikey, concurrency=4):
+    """
+    :param server: Grok server URL
+    :param apikey: Grok API key
+    :param concurrency: number of concurrent requests
+    """
+    if concurrency < 1:
+      raise ValueError("concurrency must be positive")
+
+    self._server = server
+    self._apikey = apikey
+    self._concurrency = concurrency
+
+
+  def exportModels(self, outp, errorStream=sys.stderr):
+    """ Write the definition of every model to `outp`, one JSON object per line.
+
+    Models are written in the order in which their export completes. Models
+    that cannot be exported (e.g. because they were deleted after being
+    listed) are reported and skipped.
+
+    :param outp: file-like object open for writing
+    :param errorStream: file-like object for reporting failed models, or None
+    :returns: ExportStats
+    """
+    sessions = _SessionPool(self._server, self._apikey)
+    models = sessions.session.listModels()
+
+    lock = threading.Lock()
+    modelIdQueue = Queue.Queue()
+    numExported = [0]
+    failedModelIds = []
+
+    for model in models:
+      modelIdQueue.put(model["uid"])
+
+    def worker():
+      while True:
+        modelId = modelIdQueue.get()
+        if modelId is self._STOP:
+          return
+
+        try:
+          specs = sessions.session.exportModel(modelId)
+
+          if isinstance(specs, dict):
+            specs = [specs]
+
+          if (not isinstance(specs, list) or
+              not all(isinstance(spec, dict) for spec in specs)):
+            # GrokSession returns None on some connection errors
+            raise GrokCLIError("Unexpected export response: %r" % (specs,))
+
+          lines = "".join(json.dumps(spec) + "\n" for spec in specs)
+        except Exception as e: # pylint: disable=W0703
+          # Record the failure and keep going, so that a connection error
+          # doesn't silently end this worker
+          with lock:
+            failedModelIds.append(modelId)
+            if errorStream is not None:
+              print >> errorStream, "Failed to export model %s: %s" % (
+                modelId, unicode(e) or repr(e))
+          continue
+
+        with lock:
+          outp.write(lines)
+          numExported[0] += len(specs)
+
+    for _ in xrange(self._concurrency):
+      modelIdQueue.put(self._STOP)
+
+    for thread in _runWorkers(self._concurrency, worker):
+      thread.join()
+
+    outp.flush()
+
+    return ExportStats(numExported=numExported[0],
+                       failedModelIds=failedModelIds)
@@ -0,0 +1,481 @@
+#------------------------------------------------------------------------------
+# Copyright 2013-2014 Numenta Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#------------------------------------------------------------------------------
+"""Bulk, resumable upload of custom metric data to the Grok custom metric
+endpoint, which accepts the Carbon plaintext protocol on port 2003.
+
+Input files contain one (metric, value, timestamp) row per line, separated by
+commas (CSV), tabs (TSV) or whitespace; they may be gzip-compressed. A header
+row, blank lines and lines starting with "#" are skipped. Timestamps are unix
+timestamps in seconds.
+
+Rows are sent in batches over a pool of persistent connections, throttled to an
+optional maximum rate. The offset just past the last row known to have been sent
+is periodically saved to a checkpoint file, so that an interrupted upload can be
+resumed from there. Since rows are sent in batches over several connections,
+resuming may re-send up to a few batches of rows that were sent after the last
+checkpoint; Grok keeps the last value received for a given metric and
+timestamp, so this is harmless.
+"""
+
+from collections import namedtuple
+import gzip
+import json
+import os
+import Queue
+import socket
+import sys
+import threading
+import time
+
+from grokcli.exceptions import CustomMetricUploadError
+
+
+
+DEFAULT_PORT = 2003
+
+
+# Result of CustomMetricUploader.upload()
+# numRows: number of rows sent
+# numSkipped: number of malformed rows that were skipped
+# numBytes: number of bytes sent
+# startOffset: input file offset that the upload started from
+# endOffset: input file offset just past the last row sent
+# duration: elapsed time in seconds
+UploadStats = namedtuple("UploadStats",
+                         "numRows numSkipped numBytes startOffset endOffset "
+                         "duration")
+
+
+
+def openInputFile(path):
+  """ Open an input file for reading, transparently decompressing it if it is
+  gzip-compressed.
+
+  :param path: path of input file
+  :returns: file-like object opened in binary mode
+  """
+  with open(path, "rb") as f:
+    magic = f.read(2)
+
+  if magic == "\x1f\x8b":
+    return gzip.open(path, "rb")
+
+  return open(path, "rb")
+
+
+
+def parseRow(line):
+  """ Parse an input row and convert it to a Carbon plaintext protocol line
+
+  :param line: input line; comma-, tab- or whitespace-separated metric name,
+    value and unix timestamp
+  :returns: Carbon plaintext protocol line ("{metric} {value} {timestamp}\\n");
+    None if the line is blank or a comment
+  :raises ValueError: if the line is malformed
+  """
+  line = line.strip()
+  if not line or line.startswith("#"):
+    return None
+
+  if "\t" in line:
+    fields = line.split("\t")
+  elif "," in line:
+    fields = line.split(",")
+  else:
+    fields = line.split()
+
+  if len(fields) != 3:
+    raise ValueError("Expected 3 fields, but got %d" % (len(fields),))
+
+  metricName = fields[0].strip()
+  if not metricName or len(metricName.split()) != 1:
+    raise ValueError("Invalid metric name %r" % (metricName,))
+
+  value = float(fields[1])
+  timestamp = int(float(fields[2]))
+
+  return "%s %r %d\n" % (metricName, value, timestamp)
+
+
+
+class _RateLimiter(object):
+  """ Token bucket that limits throughput to a given number of rows per second
+  """
+
+  def __init__(self, rate, burst=None):
+    """
+    :param rate: maximum sustained rate, in rows per second
+    :param burst: maximum number of rows that may be sent at once after an idle
+      period; defaults to one second's worth of rows
+    """
+    self._rate = float(rate)
+    self._capacity = float(burst if burst is not None else rate)
+    self._tokens = self._capacity
+    self._lastTime = time.time()
+
+
+  def acquire(self, numRows):
+    """ Block until `numRows` rows may be sent """
+    now = time.time()
+    self._tokens = min(self._capacity,
+                       self._tokens + (now - self._lastTime) * self._rate)
+    self._lastTime = now
+
+    self._tokens -= numRows
+    if self._tokens < 0:
+      time.sleep(-self._tokens / self._rate)
+
+
+
+class _Batch(object):
+  """ A batch of Carbon protocol lines to be sent over a single connection """
+  __slots__ = ("seq", "endOffset", "numRows", "payload")
+
+  def __init__(self, seq, endOffset, numRows, payload):
+    """
+    :param seq: sequence number of the batch, starting at 0
+    :param endOffset: input file offset just past the batch's last row
+    :param numRows: number of rows in the batch
+    :param payload: Carbon protocol lines
+    """
+    self.seq = seq
+    self.endOffset = endOffset
+    self.numRows = numRows
+    self.payload = payload
+
+
+
+class CustomMetricUploader(object):
+  """ Streams custom metric data from a file to the Grok custom metric endpoint
+  over a pool of connections.
+
+  ::
+
+      uploader = CustomMetricUploader("grok.example.com", numConnections=4,
+                                      maxRowsPerSec=10000)
+      stats = uploader.upload("data.csv.gz")
+  """
+
+  def __init__(self, host, port=DEFAULT_PORT, numConnections=4, batchSize=1000,
+               maxRowsPerSec=None, checkpointPath=None,
+               checkpointIntervalSec=5, progressIntervalSec=10,
+               progressStream=sys.stderr, maxRetries=5, socketTimeout=30):
+    """
+    :param host: Grok server hostname
+    :param port: custom metric endpoint port
+    :param numConnections: number of concurrent connections
+    :param batchSize: maximum number of rows per batch
+    :param maxRowsPerSec: maximum upload rate in rows per second; None for
+      unlimited
+    :param checkpointPath: path of checkpoint file; None to default to the
+      input file path with ".checkpoint" appended
+    :param checkpointIntervalSec: how often to save the checkpoint
+    :param progressIntervalSec: how often to report progress; None to disable
+      progress reports
+    :param progressStream: file-like object for progress reports
+    :param maxRetries: maximum number of consecutive reconnection attempts
+      per batch before giving up
+    :param socketTimeout: socket timeout in seconds
+    """
+    if numConnections < 1:
+      raise ValueError("numConnections must be positive")
+    if batchSize < 1:
+      raise ValueError("batchSize must be positive")
+    if maxRowsPerSec is not None and maxRowsPerSec <= 0:
+      raise ValueError("maxRowsPerSec must be positive")
+
+    self._host = host
+    self._port = port
+    self._numConnections = numConnections
+    self._batchSize = batchSize
+    self._maxRowsPerSec = maxRowsPerSec
+    self._checkpointPath = checkpointPath
+    self._checkpointIntervalSec = checkpointIntervalSec
+    self._progressIntervalSec = progressIntervalSec
+    self._progressStream = progressStream
+    self._maxRetries = maxRetries
+    self._socketTimeout = socketTimeout
+
+    # Upload state; reset by upload()
+    self._lock = threading.Lock()
+    self._queue = None
+    self._failure = None
+    self._completedBatches = None
+    self._nextSeqToCommit = 0
+    self._committedOffset = 0
+    self._committedRows = 0
+    self._bytesSent = 0
+
+
+  def getCheckpointPath(self, path):
+    """ :returns: path of the checkpoint file for the given input file """
+    if self._checkpointPath is not None:
+      return self._checkpointPath
+
+    return path + ".checkpoint"
+
+
+  def loadCheckpoint(self, path):
+    """ Load the checkpoint of a previous upload of the given input file
+
+    :param path: path of input file
+    :returns: dict with "offset" and "rows" properties; None if there is no
+      checkpoint
+    :raises CustomMetricUploadError: if the checkpoint belongs to a different
+      input file
+    """
+    checkpointPath = self.getCheckpointPath(path)
+    if not os.path.exists(checkpointPath):
+      return None
+
+    with open(checkpointPath, "r") as f:
+      checkpoint = json.load(f)
+
+    if checkpoint["path"] != os.path.abspath(path):
+      raise CustomMetricUploadError(
+        "Checkpoint file %s belongs to a different input file %s"
+        % (checkpointPath, checkpoint["path"]))
+
+    return checkpoint
+
+
+  def upload(self, path, resume=True):
+    """ Upload the given input file
+
+    :param path: path of input file
+    :param resume: resume from the last checkpoint of this input file, if any;
+      if False, start from the beginning of the file
+
+    :returns: upload statistics
+    :rtype: UploadStats
+
+    :raises CustomMetricUploadError: if the upload could not be completed; the
+      checkpoint reflects the progress made
+    """
+    startOffset = 0
+    startRows = 0
+    if resume:
+      checkpoint = self.loadCheckpoint(path)
+      if checkpoint is not None:
+        startOffset = checkpoint["offset"]
+        startRows = checkpoint["rows"]
+
+    self._queue = Queue.Queue(maxsize=self._numConnections * 2)
+    self._failure = None
+    self._completedBatches = dict()
+    self._nextSeqToCommit = 0
+    self._committedOffset = startOffset
+    self._committedRows = startRows
+    self._bytesSent = 0
+
+    senders = [threading.Thread(target=self._runSender,
+                                name="CustomMetricSender-%d" % (i,))
+               for i in xrange(self._numConnections)]
+    for sender in senders:
+      sender.setDaemon(True)
+      sender.start()
+
+    startTime = time.time()
+    numSkipped = 0
+    try:
+      numSkipped = self._produceBatches(path, startOffset, startTime)
+    finally:
+      for _ in senders:
+        self._queue.put(None)
+      for sender in senders:
+        sender.join()
+
+      self._saveCheckpoint(path)
+
+    duration = time.time() - startTime
+    stats = UploadStats(numRows=self._committedRows - startRows,
+                        numSkipped=numSkipped,
+                        numBytes=self._bytesSent,
+                        startOffset=startOffset,
+                        endOffset=self._committedOffset,
+                        duration=duration)
+
+    if self._failure is not None:
+      raise CustomMetricUploadError(
+        "Upload failed after sending %d rows; resume from offset %d: %r"
+        % (stats.numRows, stats.endOffset, self._failure))
+
+    self._reportProgress(stats.numRows, stats.duration, final=True)
+
+    return stats
+
+
+  def _produceBatches(self, path, startOffset, startTime):
+    """ Read the input file and queue batches for the senders
+
+    :returns: number of malformed rows skipped
+    """
+    rateLimiter = None
+    if self._maxRowsPerSec is not None:
+      rateLimiter = _RateLimiter(self._maxRowsPerSec)
+
+    lastCheckpointTime = lastProgressTime = time.time()
+    numSkipped = 0
+    seq = 0
+    offset = startOffset
+    lineNumber = 0
+    lines = []
+
+    with openInputFile(path) as f:
+      if startOffset:
+        f.seek(startOffset)
+
+      while self._failure is None:
+        line = f.readline()
+        if line:
+          lineNumber += 1
+          offset += len(line)
+          try:
+            carbonLine = parseRow(line)
+          except ValueError as e:
+            # Tolerate a header row at the start of the file
+            if not (lineNumber == 1 and startOffset == 0):
+              numSkipped += 1
+              if numSkipped <= 10:
+                self._log("Skipping malformed row at offset %d: %s"
+                          % (offset - len(line), e))
+            carbonLine = None
+
+          if carbonLine is not None:
+            lines.append(carbonLine)
+
+        if lines and (len(lines) >= self._batchSize or not line):
+          if rateLimiter is not None:
+            rateLimiter.acquire(len(lines))
+
+          self._queue.put(_Batch(seq=seq, endOffset=offset,
+                                 numRows=len(lines), payload="".join(lines)))
+          seq += 1
+          lines = []
+
+          now = time.time()
+          if now - lastCheckpointTime >= self._checkpointIntervalSec:
+            self._saveCheckpoint(path)
+            lastCheckpointTime = now
+
+          if (self._progressIntervalSec is not None and
+              now - lastProgressTime >= self._progressIntervalSec):
+            with self._lock:
+              numRows = self._committedRows
+            self._reportProgress(numRows, now - startTime)
+            lastProgressTime = now
+
+        if not line:
+          break
+
+    return numSkipped
+
+
+  def _runSender(self):
+    """ Sender thread: sends queued batches over a persistent connection """
+    sock = None
+    try:
+      while True:
+        batch = self._queue.get()
+        if batch is None:
+          break
+
+        if self._failure is not None:
+          # Drain the queue without sending
+          continue
+
+        retries = 0
+        while True:
+          try:
+            if sock is None:
+              sock = socket.create_connection((self._host, self._port),
+                                              timeout=self._socketTimeout)
+            sock.sendall(batch.payload)
+            break
+          except socket.error as e:
+            if sock is not None:
+              sock.close()
+              sock = None
+
+            retries += 1
+            if retries > self._maxRetries:
+              self._failure = e
+              break
+
+            time.sleep(min(0.5 * 2 ** (retries - 1), 10))
+
+        if self._failure is None:
+          self._commitBatch(batch)
+    finally:
+      if sock is not None:
+        self._closeConnection(sock)
+
+
+  def _commitBatch(self, batch):
+    """ Record a sent batch and advance the committed offset over contiguous
+    sent batches
+    """
+    with self._lock:
+      self._bytesSent += len(batch.payload)
+      self._completedBatches[batch.seq] = batch
+
+      while self._nextSeqToCommit in self._completedBatches:
+        committed = self._completedBatches.pop(self._nextSeqToCommit)
+        self._committedOffset = committed.endOffset
+        self._committedRows += committed.numRows
+        self._nextSeqToCommit += 1
+
+
+  @staticmethod
+  def _closeConnection(sock):
+    """ Gracefully close a connection, allowing the server to consume all the
+    data sent
+    """
+    try:
+      sock.shutdown(socket.SHUT_WR)
+      sock.recv(4096)
+    except socket.error:
+      pass
+    finally:
+      sock.close()
+
+
+  def _saveCheckpoint(self, path):
+    """ Atomically save the committed offset to the checkpoint file """
+    with self._lock:
+      checkpoint = {"path": os.path.abspath(path),
+                    "offset": self._committedOffset,
+                    "rows": self._committedRows}
+
+    checkpointPath = self.getCheckpointPath(path)
+    tempPath = checkpointPath + ".tmp"
+    with open(tempPath, "w") as f:
+      json.dump(checkpoint, f)
+    os.rename(tempPath, checkpointPath)
+
+
+  def _reportProgress(self, numRows, duration, final=False):
+    if self._progressIntervalSec is None:
+      return
+
+    rate = numRows / duration if duration > 0 else 0.0
+    self._log("%s %d rows in %.1fs (%.0f rows/sec)"
+              % ("Uploaded" if final else "Sent", numRows, duration, rate))
+
+
+  def _log(self, msg):
+    if self._progressStream is not None:
+      print >> self._progressStream, msg
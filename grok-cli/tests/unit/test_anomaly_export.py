@@ -0,0 +1,441 @@
+#------------------------------------------------------------------------------
+# Copyright 2013-2014 Numenta Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#------------------------------------------------------------------------------
+""" Anomaly export daemon tests against a local stub Grok server and local
+fake sinks.
+"""
+import BaseHTTPServer
+import calendar
+import json
+import os
+import re
+import shutil
+import socket
+import SocketServer
+import tempfile
+import threading
+import time
+import urlparse
+import unittest2 as unittest
+
+import msgpack
+
+from grokcli.anomalyexport import (
+  AnomalyExporter,
+  DatadogSink,
+  FileSink,
+  GraphiteSink,
+  retryWithBackoff,
+  transformAnomalyScore)
+
+
+
+_START_TIMESTAMP = 1400000000
+
+
+
+class _StubGrokHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """ Serves /_models and the msgpack flavor of /_models/<id>/data """
+
+  def log_message(self, *args): # pylint: disable=W0221
+    pass
+
+
+  def do_GET(self): # pylint: disable=C0103
+    server = self.server
+    url = urlparse.urlparse(self.path)
+    query = dict(urlparse.parse_qsl(url.query))
+
+    if url.path == "/_models":
+      with server.lock:
+        models = [{"uid": uid, "name": "metric." + uid, "server": "host-" + uid}
+                  for uid in sorted(server.rows)]
+      self._respond(200, json.dumps(models))
+      return
+
+    match = re.match(r"^/_models/([^/]+)/data$", url.path)
+    if not match:
+      self._respond(404, "")
+      return
+
+    assert "application/octet-stream" in self.headers.get("Accept", "")
+
+    with server.lock:
+      server.dataRequests.append((match.group(1), query))
+      rows = list(server.rows[match.group(1)])
+
+    # Only scored rows
+    rows = [row for row in rows if row[2] is not None]
+
+    if "from" in query:
+      fromTimestamp = calendar.timegm(
+        time.strptime(query["from"], "%Y-%m-%d %H:%M:%S"))
+      rows = [row for row in rows if row[0] >= fromTimestamp]
+    else:
+      rows.reverse()
+
+    # Like the Grok server, stream the header, then each row; the response is
+    # delimited by closing the connection
+    self.send_response(200)
+    self.send_header("Content-Type", "application/octet-stream")
+    self.end_headers()
+
+    packer = msgpack.Packer()
+    self.wfile.write(packer.pack(("names", "uid", "timestamp", "value",
+                                  "anomaly_score", "rowid")))
+
+    limit = int(query.get("limit", 0))
+    for i, (timestamp, value, score, rowid) in enumerate(rows):
+      if limit and i >= limit:
+        break
+      try:
+        self.wfile.write(
+          packer.pack((match.group(1), timestamp, value, score, rowid)))
+      except socket.error:
+        # The client closed the stream once it had read enough records
+        break
+
+
+  def _respond(self, status, payload, contentType="application/json"):
+    self.send_response(status)
+    self.send_header("Content-Type", contentType)
+    self.send_header("Content-Length", str(len(payload)))
+    self.end_headers()
+    self.wfile.write(payload)
+
+
+
+class _FakeDatadogHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """ Accepts Datadog series API requests, failing the first `numFailures` """
+
+  def log_message(self, *args): # pylint: disable=W0221
+    pass
+
+
+  def do_POST(self): # pylint: disable=C0103
+    server = self.server
+    body = self.rfile.read(int(self.headers["Content-Length"]))
+
+    with server.lock:
+      if server.numFailures:
+        server.numFailures -= 1
+        status = 500
+      else:
+        server.requests.append((self.path, json.loads(body)))
+        status = 202
+
+    self.send_response(status)
+    self.send_header("Content-Length", "2")
+    self.end_headers()
+    self.wfile.write("{}")
+
+
+
+class _HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  allow_reuse_address = True
+  daemon_threads = True
+
+  def __init__(self, handlerClass):
+    BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), handlerClass)
+    self.lock = threading.Lock()
+    self.url = "http://127.0.0.1:%d" % (self.server_address[1],)
+
+
+
+class _CarbonHandler(SocketServer.StreamRequestHandler):
+  def handle(self):
+    for line in self.rfile:
+      with self.server.lock:
+        self.server.lines.append(line)
+
+
+
+class _FakeCarbonListener(SocketServer.ThreadingTCPServer):
+  allow_reuse_address = True
+  daemon_threads = True
+
+  def __init__(self):
+    SocketServer.ThreadingTCPServer.__init__(self, ("127.0.0.1", 0),
+                                             _CarbonHandler)
+    self.lock = threading.Lock()
+    self.lines = []
+    self.port = self.server_address[1]
+
+
+  def waitForLines(self, count, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+      with self.lock:
+        if len(self.lines) >= count:
+          break
+      time.sleep(0.01)
+    with self.lock:
+      return list(self.lines)
+
+
+
+class _FailingSink(object):
+  def __init__(self):
+    self.numCalls = 0
+
+  def send(self, metric, records):
+    self.numCalls += 1
+    raise IOError("sink unavailable")
+
+  def close(self):
+    pass
+
+
+
+class TestAnomalyExport(unittest.TestCase):
+  """ Test incremental anomaly export """
+
+  def setUp(self):
+    self.tempDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tempDir)
+
+    self.grok = self._startServer(_HTTPServer(_StubGrokHandler))
+    self.grok.rows = {}
+    self.grok.dataRequests = []
+
+    self.outputPath = os.path.join(self.tempDir, "export.ndjson")
+    self.watermarkPath = os.path.join(self.tempDir, "watermarks.json")
+
+
+  def _startServer(self, server):
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    self.addCleanup(server.server_close)
+    self.addCleanup(server.shutdown)
+    return server
+
+
+  def _addRows(self, uid, count, unscored=0):
+    """ Append `count` scored rows and `unscored` rows without anomaly score to
+    the metric's data
+    """
+    with self.grok.lock:
+      rows = self.grok.rows.setdefault(uid, [])
+      # Drop trailing unscored rows; they get scored below
+      while rows and rows[-1][2] is None:
+        rows.pop()
+      for i in xrange(count + unscored):
+        rowid = len(rows) + 1
+        score = None if i >= count else (rowid % 10) / 10.0
+        rows.append((_START_TIMESTAMP + rowid * 300, float(rowid), score,
+                     rowid))
+
+
+  def _createExporter(self, sink, **kwargs):
+    kwargs.setdefault("watermarkPath", self.watermarkPath)
+    kwargs.setdefault("retryDelaySec", 0)
+    kwargs.setdefault("progressStream", None)
+    return AnomalyExporter(self.grok.url, "apikey", sink, **kwargs)
+
+
+  def _readOutput(self):
+    with open(self.outputPath) as f:
+      return [json.loads(line) for line in f]
+
+
+  def testTransformAnomalyScore(self):
+    self.assertEqual(transformAnomalyScore(1.0), 1.0)
+    self.assertAlmostEqual(transformAnomalyScore(0.0), 0.0)
+    self.assertAlmostEqual(transformAnomalyScore(0.99), 0.2, places=6)
+
+
+  def testRetryWithBackoff(self):
+    delays = []
+    attempts = []
+
+    def flaky():
+      attempts.append(1)
+      if len(attempts) < 3:
+        raise IOError("transient")
+      return "ok"
+
+    self.assertEqual(retryWithBackoff(flaky, maxRetries=3, initialDelaySec=1,
+                                      sleep=delays.append), "ok")
+    self.assertEqual(delays, [1, 2])
+
+    def broken(error):
+      attempts.append(1)
+      raise error
+
+    # Retries are exhausted
+    del attempts[:]
+    with self.assertRaises(IOError):
+      retryWithBackoff(lambda: broken(IOError()), maxRetries=2,
+                       sleep=lambda _: None, retryExceptions=(IOError,))
+    self.assertEqual(len(attempts), 3)
+
+    # Other errors are not retried
+    del attempts[:]
+    with self.assertRaises(ValueError):
+      retryWithBackoff(lambda: broken(ValueError()), maxRetries=2,
+                       sleep=lambda _: None, retryExceptions=(IOError,))
+    self.assertEqual(len(attempts), 1)
+
+
+  def testIncrementalExportToFile(self):
+    self._addRows("a", 10, unscored=2)
+    self._addRows("b", 7)
+
+    sink = FileSink(self.outputPath)
+    exporter = self._createExporter(sink, initialRecords=0, batchSize=4,
+                                    concurrency=2)
+
+    stats = exporter.runOnce()
+
+    self.assertEqual(stats.numRecords, 17)
+    self.assertEqual(stats.numMetrics, 2)
+    self.assertEqual(stats.failedMetricIds, [])
+
+    output = self._readOutput()
+    self.assertEqual([r["value"] for r in output if r["uid"] == "a"],
+                     [float(i) for i in xrange(1, 11)])
+    self.assertEqual([r["value"] for r in output if r["uid"] == "b"],
+                     [float(i) for i in xrange(1, 8)])
+    self.assertEqual(output[0]["metric"], "metric." + output[0]["uid"])
+    self.assertEqual(exporter.getWatermark("a"),
+                     (_START_TIMESTAMP + 10 * 300, 10))
+
+    # Nothing new: no records are exported again
+    stats = exporter.runOnce()
+    self.assertEqual(stats.numRecords, 0)
+
+    # The previously unscored rows get scored and new rows arrive
+    self._addRows("a", 4)
+    del self.grok.dataRequests[:]
+    stats = exporter.runOnce()
+    sink.close()
+
+    self.assertEqual(stats.numRecords, 4)
+    output = self._readOutput()
+    self.assertEqual([r["value"] for r in output if r["uid"] == "a"],
+                     [float(i) for i in xrange(1, 15)])
+
+    # Only records since the high-water mark were requested
+    for uid, query in self.grok.dataRequests:
+      self.assertIn("from", query)
+      self.assertEqual(query["anomaly"], "0")
+      # Older Grok servers fail msgpack requests with a limit
+      self.assertNotIn("limit", query)
+
+
+  def testInitialRecordsAndPersistentWatermarks(self):
+    self._addRows("a", 20)
+
+    sink = FileSink(self.outputPath)
+    self._createExporter(sink, initialRecords=6).runOnce()
+
+    self.assertEqual([r["value"] for r in self._readOutput()],
+                     [float(i) for i in xrange(15, 21)])
+
+    with open(self.watermarkPath) as f:
+      self.assertEqual(json.load(f),
+                       {"a": {"timestamp": _START_TIMESTAMP + 20 * 300,
+                              "rowid": 20}})
+
+    # A new exporter resumes from the saved watermark
+    self._addRows("a", 2)
+    stats = self._createExporter(sink, initialRecords=6).runOnce()
+    sink.close()
+
+    self.assertEqual(stats.numRecords, 2)
+    self.assertEqual([r["value"] for r in self._readOutput()],
+                     [float(i) for i in xrange(15, 23)])
+
+
+  def testMetricFilter(self):
+    self._addRows("a", 3)
+    self._addRows("b", 3)
+
+    sink = FileSink(self.outputPath)
+    stats = self._createExporter(sink, metricIds=["b"]).runOnce()
+    sink.close()
+
+    self.assertEqual(stats.numMetrics, 1)
+    self.assertEqual(set(r["uid"] for r in self._readOutput()), set(["b"]))
+
+
+  def testDatadogSinkRetries(self):
+    datadog = self._startServer(_HTTPServer(_FakeDatadogHandler))
+    datadog.requests = []
+    datadog.numFailures = 2
+
+    self._addRows("a", 3)
+
+    sink = DatadogSink("ddkey", url=datadog.url + "/api/v1/series")
+    stats = self._createExporter(sink).runOnce()
+
+    self.assertEqual(stats.numRecords, 3)
+    self.assertEqual(len(datadog.requests), 1)
+
+    path, payload = datadog.requests[0]
+    self.assertIn("api_key=ddkey", path)
+    series = dict((s["metric"], s) for s in payload["series"])
+    self.assertEqual(sorted(series), ["metric.a.anomalyScore", "metric.a.value"])
+    self.assertEqual(series["metric.a.value"]["host"], "host-a")
+    self.assertEqual(series["metric.a.value"]["points"],
+                     [[_START_TIMESTAMP + i * 300, float(i)]
+                      for i in xrange(1, 4)])
+    self.assertEqual(
+      series["metric.a.anomalyScore"]["points"],
+      [[_START_TIMESTAMP + i * 300, transformAnomalyScore(i / 10.0)]
+       for i in xrange(1, 4)])
+
+
+  def testGraphiteSink(self):
+    listener = _FakeCarbonListener()
+    self._startServer(listener)
+
+    self._addRows("a", 3)
+
+    sink = GraphiteSink("127.0.0.1", listener.port, prefix="test")
+    self._createExporter(sink).runOnce()
+    sink.close()
+
+    lines = listener.waitForLines(6)
+    self.assertEqual(len(lines), 6)
+    self.assertIn("test.host-a.metric_a.value 1.0 %d\n"
+                  % (_START_TIMESTAMP + 300,), lines)
+    self.assertIn("test.host-a.metric_a.anomalyScore %r %d\n"
+                  % (transformAnomalyScore(0.3), _START_TIMESTAMP + 900),
+                  lines)
+
+
+  def testSinkFailureKeepsWatermark(self):
+    self._addRows("a", 3)
+
+    sink = _FailingSink()
+    stats = self._createExporter(sink, maxRetries=2).runOnce()
+
+    self.assertEqual(stats.failedMetricIds, ["a"])
+    self.assertEqual(stats.numRecords, 0)
+    self.assertEqual(sink.numCalls, 3)
+
+    # The records are exported once the sink recovers
+    sink = FileSink(self.outputPath)
+    stats = self._createExporter(sink).runOnce()
+    sink.close()
+
+    self.assertEqual(stats.numRecords, 3)
+
+
+
+if __name__ == "__main__":
+  unittest.main()
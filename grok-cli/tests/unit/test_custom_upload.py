@@ -0,0 +1,237 @@
+#------------------------------------------------------------------------------
+# Copyright 2013-2014 Numenta Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#------------------------------------------------------------------------------
+""" `grok custom upload` tests against a local fake Carbon listener.
+"""
+import gzip
+import json
+import os
+import shutil
+import SocketServer
+import tempfile
+import threading
+import time
+import unittest2 as unittest
+
+from grokcli.exceptions import CustomMetricUploadError
+from grokcli.uploader import CustomMetricUploader, parseRow
+
+
+
+class _CarbonHandler(SocketServer.StreamRequestHandler):
+  def handle(self):
+    for line in self.rfile:
+      with self.server.lock:
+        self.server.lines.append(line)
+
+
+
+class _FakeCarbonListener(SocketServer.ThreadingTCPServer):
+  """ Collects the lines received over Carbon plaintext protocol connections
+  """
+  allow_reuse_address = True
+  daemon_threads = True
+
+  def __init__(self):
+    SocketServer.ThreadingTCPServer.__init__(self, ("127.0.0.1", 0),
+                                             _CarbonHandler)
+    self.lock = threading.Lock()
+    self.lines = []
+    self.port = self.server_address[1]
+
+
+  def waitForLines(self, count, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+      with self.lock:
+        if len(self.lines) >= count:
+          return list(self.lines)
+      time.sleep(0.01)
+    with self.lock:
+      return list(self.lines)
+
+
+
+class TestCustomUpload(unittest.TestCase):
+  """ Test `grok custom upload` """
+
+  def setUp(self):
+    self.tempDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tempDir)
+
+    self.listener = _FakeCarbonListener()
+    thread = threading.Thread(target=self.listener.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    self.addCleanup(self.listener.server_close)
+    self.addCleanup(self.listener.shutdown)
+
+
+  def _writeInput(self, name, rows, delimiter=",", header=True,
+                  compress=False):
+    path = os.path.join(self.tempDir, name)
+    opener = gzip.open if compress else open
+    with opener(path, "wb") as f:
+      if header:
+        f.write(delimiter.join(("metric", "value", "timestamp")) + "\n")
+      for row in rows:
+        f.write(delimiter.join(str(field) for field in row) + "\n")
+    return path
+
+
+  def _createUploader(self, **kwargs):
+    kwargs.setdefault("numConnections", 3)
+    kwargs.setdefault("batchSize", 7)
+    kwargs.setdefault("progressStream", None)
+    return CustomMetricUploader("127.0.0.1", port=self.listener.port, **kwargs)
+
+
+  @staticmethod
+  def _rows(count, start=0):
+    return [("test.metric%d" % (i % 5,), float(i), 1400000000 + i * 300)
+            for i in xrange(start, start + count)]
+
+
+  @staticmethod
+  def _expectedLines(rows):
+    return sorted("%s %r %d\n" % row for row in rows)
+
+
+  def testParseRow(self):
+    self.assertEqual(parseRow("a.b,1.5,1400000000\n"), "a.b 1.5 1400000000\n")
+    self.assertEqual(parseRow("a.b\t2\t1400000000.0\n"),
+                     "a.b 2.0 1400000000\n")
+    self.assertEqual(parseRow("a.b 3 1400000000\n"), "a.b 3.0 1400000000\n")
+    self.assertIsNone(parseRow("\n"))
+    self.assertIsNone(parseRow("# comment\n"))
+
+    with self.assertRaises(ValueError):
+      parseRow("a.b,1\n")
+
+    with self.assertRaises(ValueError):
+      parseRow("a.b,x,1400000000\n")
+
+
+  def testUploadCSV(self):
+    rows = self._rows(100)
+    path = self._writeInput("data.csv", rows)
+
+    stats = self._createUploader().upload(path)
+
+    self.assertEqual(stats.numRows, 100)
+    self.assertEqual(stats.numSkipped, 0)
+    self.assertEqual(stats.endOffset, os.path.getsize(path))
+    self.assertEqual(sorted(self.listener.waitForLines(100)),
+                     self._expectedLines(rows))
+
+
+  def testUploadGzippedTSV(self):
+    rows = self._rows(50)
+    path = self._writeInput("data.tsv.gz", rows, delimiter="\t",
+                            compress=True)
+
+    stats = self._createUploader().upload(path)
+
+    self.assertEqual(stats.numRows, 50)
+    self.assertEqual(sorted(self.listener.waitForLines(50)),
+                     self._expectedLines(rows))
+
+
+  def testMalformedRowsAreSkipped(self):
+    path = self._writeInput("data.csv", self._rows(3), header=False)
+    with open(path, "ab") as f:
+      f.write("bad,row\n")
+      f.write("test.metric0,4.0,1400001200\n")
+
+    stats = self._createUploader().upload(path)
+
+    self.assertEqual(stats.numRows, 4)
+    self.assertEqual(stats.numSkipped, 1)
+    self.assertEqual(len(self.listener.waitForLines(4)), 4)
+
+
+  def testResumeFromCheckpoint(self):
+    rows = self._rows(40)
+    path = self._writeInput("data.csv", rows)
+
+    stats = self._createUploader().upload(path)
+    self.assertEqual(stats.numRows, 40)
+    self.listener.waitForLines(40)
+
+    # Rows appended after a completed upload are the only ones sent on resume
+    moreRows = self._rows(10, start=40)
+    with open(path, "ab") as f:
+      for row in moreRows:
+        f.write(",".join(str(field) for field in row) + "\n")
+
+    stats = self._createUploader().upload(path)
+
+    self.assertEqual(stats.numRows, 10)
+    self.assertEqual(sorted(self.listener.waitForLines(50)),
+                     self._expectedLines(rows + moreRows))
+
+    with open(path + ".checkpoint") as f:
+      checkpoint = json.load(f)
+    self.assertEqual(checkpoint["offset"], os.path.getsize(path))
+    self.assertEqual(checkpoint["rows"], 50)
+
+    # Restarting ignores the checkpoint
+    stats = self._createUploader().upload(path, resume=False)
+    self.assertEqual(stats.numRows, 50)
+
+
+  def testFailureLeavesResumableCheckpoint(self):
+    rows = self._rows(20)
+    path = self._writeInput("data.csv", rows)
+    checkpointPath = os.path.join(self.tempDir, "upload.checkpoint")
+
+    # Nothing is listening on the port of a closed listener
+    closedListener = _FakeCarbonListener()
+    closedPort = closedListener.port
+    closedListener.server_close()
+
+    failingUploader = CustomMetricUploader(
+      "127.0.0.1", port=closedPort, numConnections=2, batchSize=5,
+      checkpointPath=checkpointPath, progressStream=None, maxRetries=0)
+    with self.assertRaises(CustomMetricUploadError):
+      failingUploader.upload(path)
+
+    with open(checkpointPath) as f:
+      self.assertEqual(json.load(f)["offset"], 0)
+
+    # Resume against a working endpoint
+    stats = self._createUploader(checkpointPath=checkpointPath).upload(path)
+
+    self.assertEqual(stats.numRows, 20)
+    self.assertEqual(sorted(self.listener.waitForLines(20)),
+                     self._expectedLines(rows))
+
+
+  def testRateLimit(self):
+    path = self._writeInput("data.csv", self._rows(300))
+
+    start = time.time()
+    stats = self._createUploader(batchSize=10, maxRowsPerSec=200).upload(path)
+    duration = time.time() - start
+
+    # One second's worth of rows may be sent at once; the remaining 100 rows
+    # take another half second
+    self.assertEqual(stats.numRows, 300)
+    self.assertGreaterEqual(duration, 0.45)
+    self.assertEqual(len(self.listener.waitForLines(300)), 300)
+
+
+if __name__ == "__main__":
+  unittest.main()
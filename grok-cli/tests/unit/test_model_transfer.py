@@ -0,0 +1,303 @@
+#------------------------------------------------------------------------------
+# Copyright 2013-2014 Numenta Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#------------------------------------------------------------------------------
+""" `grok import` and `grok export --ndjson` tests against a local stub Grok
+server.
+"""
+import BaseHTTPServer
+import json
+import os
+import re
+import shutil
+import SocketServer
+import StringIO
+import tempfile
+import threading
+import unittest2 as unittest
+
+import grokcli
+from grokcli.api import GrokSession
+from grokcli.exceptions import GrokCLIError
+from grokcli.modeltransfer import (
+  iterModelSpecs,
+  ModelExporter,
+  ModelImporter)
+
+
+
+class _StubGrokHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+  def log_message(self, *args): # pylint: disable=W0221
+    pass
+
+
+  def _respond(self, status, body):
+    payload = json.dumps(body)
+    self.send_response(status)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(payload)))
+    self.end_headers()
+    self.wfile.write(payload)
+
+
+  def do_GET(self): # pylint: disable=C0103
+    server = self.server
+
+    if self.path in server.dropPaths:
+      # Simulate a connection failure
+      self.close_connection = 1
+      return
+
+    if self.path == "/_models":
+      with server.lock:
+        models = [{"uid": uid} for uid in sorted(server.models)]
+      self._respond(200, models)
+      return
+
+    match = re.match(r"^/_models/([^/]+)/export$", self.path)
+    if match:
+      with server.lock:
+        spec = server.models.get(match.group(1))
+      if spec is None:
+        self._respond(404, {"result": "not found"})
+      else:
+        self._respond(200, [spec])
+      return
+
+    self._respond(404, {"result": "not found"})
+
+
+  def do_POST(self): # pylint: disable=C0103
+    server = self.server
+    specs = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+    if not isinstance(specs, list):
+      specs = [specs]
+
+    with server.lock:
+      server.postSizes.append(len(specs))
+
+    if len(specs) > 1 and server.dropChunkPosts:
+      # Simulate a connection failure of a multi-model request
+      self.close_connection = 1
+      return
+
+    # Like the Grok server, reject the whole request if any model definition
+    # is invalid
+    if any(spec.get("invalid") for spec in specs):
+      self._respond(400, {"result": "InvalidArgumentsError()"})
+      return
+
+    response = []
+    with server.lock:
+      for spec in specs:
+        uid = "uid-%s" % (spec["metric"],)
+        server.models[uid] = spec
+        response.append({"uid": uid})
+
+    self._respond(201, response)
+
+
+
+class _StubGrokServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  allow_reuse_address = True
+  daemon_threads = True
+
+  def __init__(self):
+    BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0),
+                                       _StubGrokHandler)
+    self.lock = threading.Lock()
+    self.models = {}
+    self.postSizes = []
+    self.dropPaths = set()
+    self.dropChunkPosts = False
+    self.url = "http://127.0.0.1:%d" % (self.server_address[1],)
+
+
+
+class TestModelTransfer(unittest.TestCase):
+  """ Test chunked model import and streaming model export """
+
+  def setUp(self):
+    self.tempDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tempDir)
+
+    self.server = _StubGrokServer()
+    thread = threading.Thread(target=self.server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    self.addCleanup(self.server.server_close)
+    self.addCleanup(self.server.shutdown)
+
+
+  @staticmethod
+  def _specs(count):
+    return [{"datasource": "custom", "metric": "test.metric%d" % (i,)}
+            for i in xrange(count)]
+
+
+  def testIterModelSpecs(self):
+    specs = self._specs(3)
+
+    ndjson = StringIO.StringIO(
+      "\n" + "\n".join(json.dumps(spec) for spec in specs) + "\n\n")
+    self.assertEqual(list(iterModelSpecs(ndjson)), specs)
+
+    document = StringIO.StringIO(json.dumps(specs, indent=2))
+    self.assertEqual(list(iterModelSpecs(document)), specs)
+
+    single = StringIO.StringIO(json.dumps(specs[0]))
+    self.assertEqual(list(iterModelSpecs(single)), specs[:1])
+
+    self.assertEqual(list(iterModelSpecs(StringIO.StringIO(""))), [])
+
+    malformed = StringIO.StringIO(json.dumps(specs[0]) + "\n{bad\n")
+    with self.assertRaises(GrokCLIError):
+      list(iterModelSpecs(malformed))
+
+
+  def testImportInChunks(self):
+    specs = self._specs(25)
+    results = []
+    importer = ModelImporter(self.server.url, "apikey", chunkSize=10,
+                             concurrency=3, onResult=results.append)
+
+    stats = importer.importModels(iter(specs))
+
+    self.assertEqual(stats.numImported, 25)
+    self.assertEqual(stats.failures, [])
+    self.assertEqual(sorted(self.server.postSizes), [5, 10, 10])
+    self.assertEqual(len(self.server.models), 25)
+
+    self.assertEqual(sorted(result.index for result in results), range(25))
+    for result in results:
+      self.assertIsNone(result.error)
+      self.assertEqual(result.model["uid"],
+                       "uid-%s" % (specs[result.index]["metric"],))
+
+
+  def testImportReportsFailuresAndRetriesFailedSubset(self):
+    specs = self._specs(12)
+    specs[3]["invalid"] = True
+    specs[10]["invalid"] = True
+
+    importer = ModelImporter(self.server.url, "apikey", chunkSize=5,
+                             concurrency=2)
+
+    stats = importer.importModels(specs)
+
+    # Chunks holding an invalid model are retried one model at a time, so only
+    # the invalid models fail
+    self.assertEqual(stats.numImported, 10)
+    self.assertEqual([result.index for result in stats.failures], [3, 10])
+    for result in stats.failures:
+      self.assertIsNone(result.model)
+      self.assertIn("Unable to create model", result.error)
+    self.assertEqual(len(self.server.models), 10)
+
+    # Fix up and re-import just the failed subset
+    retrySpecs = [dict(result.spec, invalid=False)
+                  for result in stats.failures]
+    stats = importer.importModels(retrySpecs)
+
+    self.assertEqual(stats.numImported, 2)
+    self.assertEqual(stats.failures, [])
+    self.assertEqual(len(self.server.models), 12)
+
+
+  def testImportFallsBackToSingleModelsOnConnectionError(self):
+    self.server.dropChunkPosts = True
+    specs = self._specs(6)
+
+    importer = ModelImporter(self.server.url, "apikey", chunkSize=3,
+                             concurrency=2)
+
+    stats = importer.importModels(specs)
+
+    self.assertEqual(stats.numImported, 6)
+    self.assertEqual(stats.failures, [])
+    self.assertEqual(len(self.server.models), 6)
+
+
+  def testImportCommandWritesFailedDefinitions(self):
+    importCommand = grokcli.commands["import"]
+
+    specs = self._specs(4)
+    specs[2]["invalid"] = True
+    inputPath = os.path.join(self.tempDir, "models.ndjson")
+    failedPath = os.path.join(self.tempDir, "failed.ndjson")
+    with open(inputPath, "w") as f:
+      for spec in specs:
+        f.write(json.dumps(spec) + "\n")
+
+    grok = GrokSession(server=self.server.url, apikey="apikey")
+    with open(inputPath) as fp:
+      with self.assertRaises(GrokCLIError) as cm:
+        importCommand.importMetricsFromFile(grok, fp, chunkSize=2,
+                                            concurrency=2,
+                                            failedOutput=failedPath)
+
+    self.assertIn("1 of 4 models failed", str(cm.exception))
+    with open(failedPath) as fp:
+      self.assertEqual(list(iterModelSpecs(fp)), [specs[2]])
+
+
+  def testExportNDJSON(self):
+    specs = self._specs(20)
+    for spec in specs:
+      self.server.models["uid-%s" % (spec["metric"],)] = spec
+
+    outp = StringIO.StringIO()
+    stats = ModelExporter(self.server.url, "apikey",
+                          concurrency=4).exportModels(outp)
+
+    self.assertEqual(stats.numExported, 20)
+    self.assertEqual(stats.failedModelIds, [])
+
+    lines = outp.getvalue().splitlines()
+    self.assertEqual(len(lines), 20)
+    exported = sorted((json.loads(line) for line in lines),
+                      key=lambda spec: spec["metric"])
+    self.assertEqual(exported,
+                     sorted(specs, key=lambda spec: spec["metric"]))
+
+    # The export round-trips through import
+    self.server.models.clear()
+    stats = ModelImporter(self.server.url, "apikey").importModels(
+      iterModelSpecs(StringIO.StringIO(outp.getvalue())))
+    self.assertEqual(stats.numImported, 20)
+    self.assertEqual(len(self.server.models), 20)
+
+
+  def testExportRecordsModelsFailingWithConnectionError(self):
+    specs = self._specs(10)
+    for spec in specs:
+      self.server.models["uid-%s" % (spec["metric"],)] = spec
+    self.server.dropPaths.add("/_models/uid-test.metric3/export")
+
+    outp = StringIO.StringIO()
+    errorStream = StringIO.StringIO()
+    stats = ModelExporter(self.server.url, "apikey",
+                          concurrency=2).exportModels(outp, errorStream)
+
+    self.assertEqual(stats.numExported, 9)
+    self.assertEqual(stats.failedModelIds, ["uid-test.metric3"])
+    self.assertIn("uid-test.metric3", errorStream.getvalue())
+    self.assertEqual(len(outp.getvalue().splitlines()), 9)
+
+
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -39,6 +39,9 @@ from htmengine.runtime import scalar_metric_utils
 import htmengine.model_swapper.utils as model_swapper_utils
 from htmengine.repository.queries import MetricStatus
 from htm.it.app.quota import Quota
+from htm.it.app.runtime.aggregator_utils import (
+  validateAggregationStatistic,
+  validateMissingPolicy)
 from htm.it.app.repository import schema
 
 
@@ -171,7 +174,17 @@ class _AutostackDatasourceAdapter(DatasourceAdapterIface):
               "metric": "CPUUtilization"
             },
 
-            "period": 300  # aggregation period; seconds
+            "period": 300,  # aggregation period; seconds
+
+            "aggregation": {  # optional
+              # one of sum, mean, min, max, count or a percentile such as
+              # p95; default: sum for metrics queried with the Sum statistic,
+              # mean otherwise
+              "statistic": "p95",
+              # treatment of member instances missing from a sample period:
+              # ignore (default), zero, previous, or drop
+              "missingPolicy": "ignore"
+            }
           },
 
           "modelParams": { # optional; specific to slave metric
@@ -228,6 +241,17 @@ class _AutostackDatasourceAdapter(DatasourceAdapterIface):
     if minVal is None or maxVal is None:
       raise ValueError("Expected min and max to be set")
 
+    aggregationSpec = metricSpec.get("aggregation")
+    if aggregationSpec is not None:
+      if not isinstance(aggregationSpec, dict):
+        raise ValueError(
+          "Expected aggregation to be a dict, but got %r; metricSpec=%r"
+          % (aggregationSpec, metricSpec))
+      if "statistic" in aggregationSpec:
+        validateAggregationStatistic(aggregationSpec["statistic"])
+      if "missingPolicy" in aggregationSpec:
+        validateMissingPolicy(aggregationSpec["missingPolicy"])
+
     swarmParams = scalar_metric_utils.generateSwarmParams(stats)
 
     @repository.retryOnTransientErrors
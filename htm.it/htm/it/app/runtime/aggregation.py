@@ -21,13 +21,163 @@
 
 """Logic for aggregating metric data"""
 
+import atexit
 import collections
 import math
 import numbers
+import os
+import threading
+import time
+
+import numpy
 
 from htm.it.app import repository
 from htm.it.app.runtime.aggregator_metric_collection import (
     EC2InstanceMetricGetter)
+from htm.it.app.runtime.aggregator_utils import (
+  AggregationStatistic,
+  MissingPolicy,
+  parsePercentileStatistic,
+  validateAggregationStatistic,
+  validateMissingPolicy)
+from htm.it.htm_it_logging import getExtendedLogger
+
+
+
+_MODULE_NAME = "htm.it.aggregation"
+
+
+
+def _getLogger():
+  return getExtendedLogger(_MODULE_NAME)
+
+
+
+class _MetricGetterService(object):
+  """ Process-wide, lazily-created EC2InstanceMetricGetter that is reused
+  across getStatistics calls, along with a short-TTL cache of the per-instance
+  statistics collected for each (autostack, metric) pair.
+
+  Creating an EC2InstanceMetricGetter forks a pool of worker processes, so doing
+  it on every call makes bulk Autostack model creation very expensive. The
+  service also keeps the getter's Autostack instance cache warm between calls.
+
+  NOTE: thread-safe; calls into the underlying EC2InstanceMetricGetter are
+  serialized, since EC2InstanceMetricGetter is not thread-safe.
+  """
+
+  # How long collected statistics remain valid for reuse
+  _STATS_CACHE_TTL_SEC = 60
+
+
+  def __init__(self, statsCacheTTLSec=_STATS_CACHE_TTL_SEC):
+    """
+    :param statsCacheTTLSec: time-to-live of cached statistics, in seconds;
+      0 disables caching
+    """
+    self._statsCacheTTLSec = statsCacheTTLSec
+
+    self._lock = threading.Lock()
+
+    # EC2InstanceMetricGetter instance; created on first use
+    self._metricGetter = None
+
+    # pid of the process that created self._metricGetter; the getter's process
+    # pool is unusable in a forked child
+    self._metricGetterPid = None
+
+    self._atexitRegistered = False
+
+    # Cache of collected statistics: each key is a (autostackUid, metricName,
+    # period) tuple and the corresponding value is a two-tuple
+    # (expirationTime, instanceMetricList)
+    self._statsCache = dict()
+
+
+  def collectMetricStatistics(self, autostack, metric):
+    """ Get a sequence of min/max statistics for a given metric from the
+    Autostack's instances, reusing recently-collected statistics if available.
+
+    See EC2InstanceMetricGetter.collectMetricStatistics for details.
+
+    :returns: a possibly empty, unordered sequence of InstanceMetricData
+      objects, each containing a single MetricRecord object in its `records`
+      attribute.
+    """
+    cacheKey = (autostack.uid, metric.name, metric.poll_interval)
+
+    with self._lock:
+      now = time.time()
+      self._purgeExpiredStats(now)
+
+      cached = self._statsCache.get(cacheKey)
+      if cached is not None:
+        _getLogger().debug("Using cached statistics for autostack=%s, "
+                           "metric=%s", autostack.uid, metric.name)
+        return cached[1]
+
+      instanceMetricList = self._getMetricGetter().collectMetricStatistics(
+        autostack, metric)
+
+      # Don't cache empty results, so that instances that are just coming up are
+      # picked up on the next call
+      if instanceMetricList and self._statsCacheTTLSec > 0:
+        self._statsCache[cacheKey] = (time.time() + self._statsCacheTTLSec,
+                                      instanceMetricList)
+
+      return instanceMetricList
+
+
+  def close(self):
+    """ Clean up: close the metric getter, if any, and clear the statistics
+    cache. The service may be used again after close.
+    """
+    with self._lock:
+      self._statsCache.clear()
+
+      if self._metricGetter is not None:
+        if self._metricGetterPid == os.getpid():
+          self._metricGetter.close()
+        self._metricGetter = None
+        self._metricGetterPid = None
+
+
+  def _getMetricGetter(self):
+    """ Get the EC2InstanceMetricGetter, creating it if needed.
+
+    NOTE: must be called with self._lock held
+    """
+    if self._metricGetter is not None and self._metricGetterPid != os.getpid():
+      # We were forked; the parent's pool belongs to the parent
+      _getLogger().info("Discarding metric getter inherited from pid=%s",
+                        self._metricGetterPid)
+      self._metricGetter = None
+      self._statsCache.clear()
+
+    if self._metricGetter is None:
+      self._metricGetter = EC2InstanceMetricGetter()
+      self._metricGetterPid = os.getpid()
+
+      if not self._atexitRegistered:
+        atexit.register(self.close)
+        self._atexitRegistered = True
+
+    return self._metricGetter
+
+
+  def _purgeExpiredStats(self, now):
+    """ Remove expired items from statistics cache
+
+    NOTE: must be called with self._lock held
+    """
+    for key, (expirationTime, _) in self._statsCache.items():
+      if expirationTime <= now:
+        del self._statsCache[key]
+
+
+
+# Shared by all getStatistics calls in this process
+_metricGetterService = _MetricGetterService()
 
 
 
@@ -60,6 +210,208 @@ def aggregate(slices, aggregationFn=average):
           for timestamp, values in sorted(instanceMetricMap.iteritems())]
 
 
+
+# Result of aggregateStatistics
+# timestamps: a (possibly empty) sequence of UTC datetime.datetime objects of
+#   the aggregated buckets in ascending order
+# values: a dict that maps each requested statistic name to a numpy array of
+#   float64 values corresponding to `timestamps`
+AggregatedStatistics = collections.namedtuple("AggregatedStatistics",
+                                              "timestamps values")
+
+
+
+def _buildSampleMatrix(slices):
+  """ Arrange the samples of the given slices in an instance-by-timestamp
+  matrix.
+
+  :param slices: slices from aggregator_metric_collection.MetricCollection
+  :returns: two-tuple (timestamps, matrix), where timestamps is a sorted list of
+    the distinct timestamps of all samples, and matrix is a numpy float64 array
+    of shape (len(slices), len(timestamps)) with NaN in place of missing
+    samples. If an instance has more than one sample with the same timestamp,
+    the last one wins.
+  """
+  numSlices = len(slices)
+
+  rows = []
+  sliceTimestamps = []
+  sliceValues = []
+  for row, instanceMetric in enumerate(slices):
+    records = instanceMetric.records
+    if not records:
+      continue
+
+    timestamps, values = zip(*records)
+    rows.append(numpy.repeat(row, len(records)))
+    sliceTimestamps.extend(timestamps)
+    sliceValues.extend(values)
+
+  if not sliceTimestamps:
+    return [], numpy.empty((numSlices, 0), dtype=numpy.float64)
+
+  timestamps = sorted(set(sliceTimestamps))
+  columnMap = dict((timestamp, col) for col, timestamp in enumerate(timestamps))
+
+  columns = numpy.fromiter((columnMap[timestamp]
+                            for timestamp in sliceTimestamps),
+                           dtype=numpy.intp, count=len(sliceTimestamps))
+
+  matrix = numpy.empty((numSlices, len(timestamps)), dtype=numpy.float64)
+  matrix.fill(numpy.nan)
+  matrix[numpy.concatenate(rows), columns] = numpy.array(sliceValues,
+                                                         dtype=numpy.float64)
+
+  return timestamps, matrix
+
+
+
+def _applyMissingPolicy(timestamps, matrix, missingPolicy):
+  """ Apply the missing-instance policy to a sample matrix
+
+  :param timestamps: sorted sequence of timestamps of the matrix columns
+  :param matrix: sample matrix as returned by _buildSampleMatrix; NOTE: may be
+    modified in place
+  :param missingPolicy: one of MissingPolicy.ALL
+
+  :returns: two-tuple (timestamps, matrix) after applying the policy
+  """
+  if missingPolicy == MissingPolicy.IGNORE:
+    return timestamps, matrix
+
+  missing = numpy.isnan(matrix)
+
+  if missingPolicy == MissingPolicy.ZERO:
+    matrix[missing] = 0.0
+
+  elif missingPolicy == MissingPolicy.PREVIOUS:
+    # Index of the most recent non-missing column at or before each column
+    lastIndexes = numpy.where(missing, 0, numpy.arange(matrix.shape[1]))
+    numpy.maximum.accumulate(lastIndexes, axis=1, out=lastIndexes)
+    matrix = matrix[numpy.arange(matrix.shape[0])[:, numpy.newaxis],
+                    lastIndexes]
+
+  elif missingPolicy == MissingPolicy.DROP:
+    complete = ~missing.any(axis=0)
+    timestamps = [timestamp for timestamp, keep in zip(timestamps, complete)
+                  if keep]
+    matrix = matrix[:, complete]
+
+  else:
+    validateMissingPolicy(missingPolicy)
+
+  return timestamps, matrix
+
+
+
+def aggregateStatistics(slices, statistics=AggregationStatistic.BASIC,
+                        missingPolicy=MissingPolicy.IGNORE):
+  """ Compute several aggregate statistics of values from multiple metrics by
+  timestamp in a single vectorized pass.
+
+  Each slice is treated as a member instance of the Autostack, including slices
+  without any records.
+
+  :param slices: slices from aggregator_metric_collection.MetricCollection.
+      NOTE: see MetricCollection documentation for important details and
+      examples.
+  :param statistics: sequence of statistics to compute; each is one of
+      AggregationStatistic.BASIC or a percentile statistic name, such as "p95"
+  :param missingPolicy: how to treat member instances that are missing from a
+      timestamp bucket; one of MissingPolicy.ALL
+
+  :returns: the requested statistics of the non-empty buckets in timestamp
+      order; buckets without any values after applying `missingPolicy` are
+      omitted
+  :rtype: AggregatedStatistics
+
+  :raises ValueError: if a statistic or missingPolicy isn't supported
+  """
+  for statistic in statistics:
+    validateAggregationStatistic(statistic)
+  validateMissingPolicy(missingPolicy)
+
+  timestamps, matrix = _buildSampleMatrix(slices)
+  timestamps, matrix = _applyMissingPolicy(timestamps, matrix, missingPolicy)
+
+  counts = numpy.sum(~numpy.isnan(matrix), axis=0)
+  nonEmpty = counts > 0
+  if not nonEmpty.all():
+    timestamps = [timestamp for timestamp, keep in zip(timestamps, nonEmpty)
+                  if keep]
+    matrix = matrix[:, nonEmpty]
+    counts = counts[nonEmpty]
+
+  if not timestamps:
+    return AggregatedStatistics(
+      timestamps=[],
+      values=dict((statistic, numpy.empty(0, dtype=numpy.float64))
+                  for statistic in statistics))
+
+  # Sorting each bucket once yields min, max and percentiles; NaN values are
+  # sorted to the end of each column
+  columns = numpy.arange(matrix.shape[1])
+  sortedMatrix = None
+  sortFreeStatistics = (AggregationStatistic.SUM, AggregationStatistic.MEAN,
+                        AggregationStatistic.COUNT)
+  if any(statistic not in sortFreeStatistics for statistic in statistics):
+    sortedMatrix = numpy.sort(matrix, axis=0)
+
+  sums = None
+  if (AggregationStatistic.SUM in statistics or
+      AggregationStatistic.MEAN in statistics):
+    sums = numpy.nansum(matrix, axis=0)
+
+  values = dict()
+  for statistic in statistics:
+    if statistic == AggregationStatistic.SUM:
+      values[statistic] = sums
+    elif statistic == AggregationStatistic.MEAN:
+      values[statistic] = sums / counts
+    elif statistic == AggregationStatistic.COUNT:
+      values[statistic] = counts.astype(numpy.float64)
+    elif statistic == AggregationStatistic.MIN:
+      values[statistic] = sortedMatrix[0]
+    elif statistic == AggregationStatistic.MAX:
+      values[statistic] = sortedMatrix[counts - 1, columns]
+    else:
+      # Percentile with linear interpolation between closest ranks, same as
+      # numpy.percentile
+      position = (counts - 1) * (parsePercentileStatistic(statistic) / 100.0)
+      lower = numpy.floor(position).astype(numpy.intp)
+      upper = numpy.ceil(position).astype(numpy.intp)
+      lowerValues = sortedMatrix[lower, columns]
+      upperValues = sortedMatrix[upper, columns]
+      values[statistic] = (
+        lowerValues + (upperValues - lowerValues) * (position - lower))
+
+  return AggregatedStatistics(timestamps=timestamps, values=values)
+
+
+
+def aggregateStatistic(slices, statistic=AggregationStatistic.MEAN,
+                       missingPolicy=MissingPolicy.IGNORE):
+  """ Aggregate values from multiple metrics by timestamp using a single
+  statistic; vectorized counterpart of `aggregate`.
+
+  :param slices: slices from aggregator_metric_collection.MetricCollection.
+  :param statistic: one of AggregationStatistic.BASIC or a percentile statistic
+      name, such as "p95"
+  :param missingPolicy: one of MissingPolicy.ALL
+
+  :returns: a sequence of aggregated metric data records suitable for sending
+      to app MetricStreamer
+  :rtype: a (possibly empty) sequence of metric data records; each metric data
+      record is a tuple (timestamp, value)
+          timestamp: UTC datetime.datetime object
+          value: value of the metric
+  """
+  result = aggregateStatistics(slices, statistics=(statistic,),
+                               missingPolicy=missingPolicy)
+
+  return zip(result.timestamps, result.values[statistic].tolist())
+
+
 def getStatistics(metric):
   """Get aggregate statistics for an Autostack metric.
 
@@ -67,6 +419,9 @@ def getStatistics(metric):
   returns no stats and there is no data in the database then an
   ObjectNotFoundError will be raised.
 
+  Statistics collected from AWS are cached briefly per (autostack, metric), so
+  repeated calls for the same Autostack metric don't re-query CloudWatch.
+
   :param metric: the Autostack metric to get statistics for
   :type metric: TODO
 
@@ -89,13 +444,12 @@ def getStatistics(metric):
     raise ValueError(
       "Metric must belong to an Autostack but has datasource=%r"
       % metric.datasource)
-  metricGetter = EC2InstanceMetricGetter()
-  try:
-    with engine.connect() as conn:
-      autostack = repository.getAutostackFromMetric(conn, metric.uid)
-    instanceMetricList = metricGetter.collectMetricStatistics(autostack, metric)
-  finally:
-    metricGetter.close()
+
+  with engine.connect() as conn:
+    autostack = repository.getAutostackFromMetric(conn, metric.uid)
+
+  instanceMetricList = _metricGetterService.collectMetricStatistics(autostack,
+                                                                    metric)
 
   n = 0
   mins = 0.0
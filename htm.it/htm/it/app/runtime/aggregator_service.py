@@ -26,6 +26,7 @@ retrieving and aggregating metric data for autostacks.
 NOTE: The first phase supports only AWS/EC2 Instances.
 """
 
+import json
 from optparse import OptionParser
 import sys
 import time
@@ -34,10 +35,12 @@ from htm.it.app import repository
 from htm.it.app.adapters.datasource.autostack.autostack_metric_adapter import (
   AutostackMetricAdapterBase)
 from htm.it.app.exceptions import ObjectNotFoundError
-from htm.it.app.runtime.aggregation import aggregate
+from htm.it.app.runtime import aggregation
 from htm.it.app.runtime.aggregator_metric_collection import (
     EC2InstanceMetricGetter,
     AutostackMetricRequest)
+from htm.it.app.runtime.aggregator_utils import (AggregationStatistic,
+                                                 MissingPolicy)
 from htmengine.runtime.metric_streamer_util import MetricStreamer
 
 from htmengine.model_swapper.model_swapper_interface import (
@@ -129,12 +132,10 @@ class AggregatorService(object):
       data = None
 
       if metricCollection.slices:
-        aggregationFn = getAggregationFn(metricObj)
-        if aggregationFn:
-          data = aggregate(metricCollection.slices,
-                           aggregationFn=aggregationFn)
-        else:
-          data = aggregate(metricCollection.slices)
+        statistic, missingPolicy = getAggregationSpec(metricObj)
+        data = aggregation.aggregateStatistic(metricCollection.slices,
+                                              statistic=statistic,
+                                              missingPolicy=missingPolicy)
 
       try:
         with engine.connect() as conn:
@@ -172,17 +173,37 @@ class AggregatorService(object):
           metricCollection.timeRange.end.isoformat())
 
 
-def getAggregationFn(metric):
-  fn = None
+def getAggregationSpec(metric):
+  """ Determine how an Autostack metric's instance data is to be aggregated
 
-  slaveDatasource = AutostackMetricAdapterBase.getMetricDatasource(metric)
-  metricAdapter = AutostackMetricAdapterBase.getMetricAdapter(slaveDatasource)
-  query = metricAdapter.getQueryParams(metric.name)
+  An "aggregation" property in the metric's metricSpec takes precedence; e.g.,
+  {"statistic": "p95", "missingPolicy": "previous"}; see
+  htm.it.app.runtime.aggregator_utils for supported values.
+  Otherwise, metrics that are queried with the "Sum" statistic are summed and
+  all others are averaged, ignoring missing instances.
 
-  if "statistics" in query and query["statistics"] == "Sum":
-    fn = sum
+  :param metric: Autostack metric row
+  :returns: two-tuple (statistic, missingPolicy)
+  """
+  metricSpec = json.loads(metric.parameters)["metricSpec"]
+  aggregationSpec = metricSpec.get("aggregation") or dict()
 
-  return fn
+  statistic = aggregationSpec.get("statistic")
+  if statistic is None:
+    slaveDatasource = metricSpec["slaveDatasource"]
+    metricAdapter = AutostackMetricAdapterBase.getMetricAdapter(
+      slaveDatasource)
+    query = metricAdapter.getQueryParams(metric.name)
+
+    if "statistics" in query and query["statistics"] == "Sum":
+      statistic = AggregationStatistic.SUM
+    else:
+      statistic = AggregationStatistic.MEAN
+
+  missingPolicy = aggregationSpec.get("missingPolicy",
+                                      MissingPolicy.IGNORE)
+
+  return statistic, missingPolicy
 
 
 def main(args):
@@ -41,3 +41,88 @@ def getAWSCredentials():
     aws_access_key_id=htm.it.app.config.get("aws", "aws_access_key_id"),
     aws_secret_access_key=htm.it.app.config.get("aws", 'aws_secret_access_key')
   )
+
+
+
+class AggregationStatistic(object):
+  """ Statistics for aggregating Autostack metric data across instances, in
+  addition to percentiles that are specified as "p<percent>"; e.g., "p50",
+  "p95", "p99.9"
+  """
+  SUM = "sum"
+  MEAN = "mean"
+  MIN = "min"
+  MAX = "max"
+  COUNT = "count"
+
+  BASIC = (SUM, MEAN, MIN, MAX, COUNT)
+
+
+
+class MissingPolicy(object):
+  """ How member instances of an Autostack that have no sample in a given
+  timestamp bucket are treated during aggregation
+  """
+  # Aggregate only the instances that reported a value (legacy behavior)
+  IGNORE = "ignore"
+
+  # Missing instances contribute a value of 0.0
+  ZERO = "zero"
+
+  # Missing instances contribute their most recent earlier value, if any, from
+  # the same collection; otherwise they are ignored
+  PREVIOUS = "previous"
+
+  # Omit buckets in which any member instance is missing
+  DROP = "drop"
+
+  ALL = (IGNORE, ZERO, PREVIOUS, DROP)
+
+
+
+def parsePercentileStatistic(statistic):
+  """ Parse a percentile aggregation statistic name
+
+  :param statistic: statistic name; e.g., "p95"
+  :returns: percentile in the range [0, 100] or None if `statistic` isn't a
+    percentile statistic name
+  :raises ValueError: if the percentile is out of range
+  """
+  if not isinstance(statistic, basestring) or not statistic.startswith("p"):
+    return None
+
+  try:
+    percent = float(statistic[1:])
+  except ValueError:
+    return None
+
+  if not 0 <= percent <= 100:
+    raise ValueError("Percentile out of range in statistic=%r" % (statistic,))
+
+  return percent
+
+
+
+def validateAggregationStatistic(statistic):
+  """ Validate an aggregation statistic name
+
+  :param statistic: one of AggregationStatistic.BASIC or a percentile statistic
+    name "p<percent>"; e.g., "p95"
+  :raises ValueError: if the statistic isn't supported
+  """
+  if (statistic not in AggregationStatistic.BASIC and
+      parsePercentileStatistic(statistic) is None):
+    raise ValueError("Unsupported aggregation statistic=%r; expected one of %s "
+                     "or p<percent>" % (statistic, AggregationStatistic.BASIC))
+
+
+
+def validateMissingPolicy(missingPolicy):
+  """ Validate a missing-instance aggregation policy
+
+  :param missingPolicy: one of MissingPolicy.ALL
+  :raises ValueError: if the policy isn't supported
+  """
+  if missingPolicy not in MissingPolicy.ALL:
+    raise ValueError("Unsupported missing-instance policy=%r; expected one of "
+                     "%s" % (missingPolicy, MissingPolicy.ALL))
@@ -448,6 +448,10 @@ class AutostackMetricsHandler(AuthenticatedBaseHandler):
             "modelParams": modelParams
           }
 
+          if "aggregation" in nativeMetric:
+            modelSpec["metricSpec"]["aggregation"] = nativeMetric.pop(
+              "aggregation")
+
           metricId = (createAutostackDatasourceAdapter()
                       .monitorMetric(modelSpec))
           with web.ctx.connFactory() as conn:
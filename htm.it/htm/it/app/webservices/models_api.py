@@ -802,7 +802,7 @@ class MetricDataHandler(AuthenticatedBaseHandler):
 
       yield packer.pack(names)
       for row in result:
-        if not limit or (limit and len(results_per_uid[row.uid]) < limit):
+        if not limit or results_per_uid[row.uid] < limit:
           resultTuple = (
               row.uid,
               calendar.timegm(row.timestamp.timetuple()),
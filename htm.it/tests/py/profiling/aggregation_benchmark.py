@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Benchmark Autostack metric aggregation: the legacy per-bucket `aggregate`
+versus the vectorized `aggregateStatistics` engine.
+
+The default workload is 1000 instances x 1 day of 5-minute samples, with a
+small fraction of samples missing.
+"""
+
+from datetime import datetime, timedelta
+from optparse import OptionParser
+import random
+import sys
+import time
+
+import numpy
+
+from htm.it.app.runtime import aggregation
+from htm.it.app.runtime.aggregator_metric_collection import (InstanceMetricData,
+                                                           MetricRecord)
+from htm.it.app.runtime.aggregator_utils import MissingPolicy
+
+
+
+def _generateSlices(numInstances, numSamples, periodSec, missingRatio):
+  """ Generate synthetic metric collection slices
+
+  :returns: sequence of InstanceMetricData objects
+  """
+  rng = random.Random(42)
+  start = datetime(2015, 1, 1)
+  timestamps = [start + timedelta(seconds=i * periodSec)
+                for i in xrange(numSamples)]
+
+  slices = []
+  for i in xrange(numInstances):
+    records = tuple(
+      MetricRecord(timestamp=timestamp, value=rng.uniform(0, 100))
+      for timestamp in timestamps
+      if rng.random() >= missingRatio)
+    slices.append(InstanceMetricData(instanceID="i-%08x" % (i,),
+                                     records=records))
+
+  return slices
+
+
+
+def _timeIt(fn, repeat):
+  """ :returns: best wall-clock time of `repeat` calls to fn, in seconds """
+  best = None
+  for _ in xrange(repeat):
+    start = time.time()
+    fn()
+    duration = time.time() - start
+    best = duration if best is None else min(best, duration)
+
+  return best
+
+
+
+def _legacyMultiStatistic(slices):
+  """ Compute all basic statistics and p95 with the legacy aggregate function,
+  one pass per statistic
+  """
+  return [aggregation.aggregate(slices, aggregationFn=fn)
+          for fn in (sum, aggregation.average, min, max, len,
+                     lambda values: numpy.percentile(values, 95))]
+
+
+
+def main(numInstances, numSamples, periodSec, missingRatio, repeat):
+  print "Generating %d instances x %d samples (missingRatio=%s)..." % (
+    numInstances, numSamples, missingRatio)
+  slices = _generateSlices(numInstances, numSamples, periodSec, missingRatio)
+
+  allStatistics = aggregation.AggregationStatistic.BASIC + ("p95",)
+
+  benchmarks = (
+    ("legacy aggregate (average)",
+     lambda: aggregation.aggregate(slices)),
+    ("aggregateStatistic (mean)",
+     lambda: aggregation.aggregateStatistic(slices)),
+    ("legacy aggregate x6 (sum,mean,min,max,count,p95)",
+     lambda: _legacyMultiStatistic(slices)),
+    ("aggregateStatistics (sum,mean,min,max,count,p95)",
+     lambda: aggregation.aggregateStatistics(slices, allStatistics)),
+    ("aggregateStatistics (all; missing=previous)",
+     lambda: aggregation.aggregateStatistics(
+       slices, allStatistics, missingPolicy=MissingPolicy.PREVIOUS)),
+  )
+
+  for name, fn in benchmarks:
+    print "%-52s %8.3fs" % (name, _timeIt(fn, repeat))
+
+
+
+def _parseArgs():
+  helpString = (
+    "%prog [options]\n\n"
+    "Benchmark Autostack metric aggregation.")
+
+  parser = OptionParser(helpString)
+
+  parser.add_option(
+    "--instances",
+    action="store",
+    type="int",
+    default=1000,
+    dest="numInstances",
+    help="Number of Autostack instances [default: %default]")
+
+  parser.add_option(
+    "--samples",
+    action="store",
+    type="int",
+    default=24 * 12,
+    dest="numSamples",
+    help="Number of samples per instance [default: %default]")
+
+  parser.add_option(
+    "--period",
+    action="store",
+    type="int",
+    default=300,
+    dest="periodSec",
+    help="Sample period in seconds [default: %default]")
+
+  parser.add_option(
+    "--missing",
+    action="store",
+    type="float",
+    default=0.01,
+    dest="missingRatio",
+    help="Fraction of missing samples [default: %default]")
+
+  parser.add_option(
+    "--repeat",
+    action="store",
+    type="int",
+    default=3,
+    dest="repeat",
+    help="Number of timed runs of each benchmark [default: %default]")
+
+  options, remainingArgs = parser.parse_args()
+  if remainingArgs:
+    parser.error("Unexpected remaining args: %r" % (remainingArgs,))
+
+  return dict(options.__dict__)
+
+
+
+if __name__ == "__main__":
+  main(**_parseArgs())
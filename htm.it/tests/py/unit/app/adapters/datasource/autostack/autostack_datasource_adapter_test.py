@@ -23,7 +23,7 @@
 """ Unit tests for AutostackDatasourceAdapter
 """
 
-from mock import patch
+from mock import Mock, patch
 import unittest
 
 import htm.it.app.adapters.datasource as datasource_adapter_factory
@@ -89,5 +89,34 @@ class AutostackDatasourceAdapterTest(unittest.TestCase):
     self.assertRaises(ObjectNotFoundError, adapter.monitorMetric, modelSpec)
 
 
+  @patch("htm.it.app.adapters.datasource.autostack.repository.getAutostack")
+  def testMonitorMetricNonDictAggregation(self, getAutostackMock,
+                                          _mockEngineFactory):
+    adapter = datasource_adapter_factory.createAutostackDatasourceAdapter()
+    modelSpec = {
+      "datasource": "autostack",
+      "metricSpec": {
+        "autostackId": "9y2wn39y823nw9y8",
+        "slaveDatasource": "cloudwatch",
+        "slaveMetric": {
+          "namespace": "AWS/EC2",
+          "metric": "CPUUtilization",
+          "dimensions": {
+            "InstanceId": None
+          },
+          "period": 300
+        },
+        "aggregation": "sum"
+      }
+    }
+    getAutostackMock.return_value = Mock(region="us-west-2")
+    getAutostackMock.return_value.name = "testStack"
+
+    with self.assertRaises(ValueError) as cm:
+      adapter.monitorMetric(modelSpec)
+
+    self.assertIn("Expected aggregation to be a dict", cm.exception.args[0])
+
+
 if __name__ == "__main__":
   unittest.main()
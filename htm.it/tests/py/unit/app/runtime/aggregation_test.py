@@ -31,6 +31,7 @@ from htm.it.app.exceptions import MetricStatisticsNotReadyError
 from htm.it.app.runtime import aggregation
 from htm.it.app.runtime.aggregator_metric_collection import (InstanceMetricData,
                                                            MetricRecord)
+from htm.it.app.runtime.aggregator_utils import MissingPolicy
 
 
 class AggregateTest(unittest.TestCase):
@@ -160,9 +161,143 @@ class AggregateTest(unittest.TestCase):
 
 
 
+class AggregateStatisticsTest(unittest.TestCase):
+  """Unit tests for the aggregateStatistics and aggregateStatistic
+  functions."""
+
+
+  def setUp(self):
+    timestamp3 = datetime.datetime.utcnow()
+    timestamp2 = timestamp3 - datetime.timedelta(minutes=5)
+    timestamp1 = timestamp2 - datetime.timedelta(minutes=5)
+    self.timestamps = (timestamp1, timestamp2, timestamp3)
+
+    # id3 is missing at timestamp1 and timestamp3; id4 has no data
+    self.slices = (
+        InstanceMetricData("id1", (
+            MetricRecord(timestamp1, 10.0),
+            MetricRecord(timestamp2, 20.0),
+            MetricRecord(timestamp3, 30.0),
+        )),
+        InstanceMetricData("id2", (
+            MetricRecord(timestamp1, 40.0),
+            MetricRecord(timestamp2, 50.0),
+            MetricRecord(timestamp3, 60.0),
+        )),
+        InstanceMetricData("id3", (
+            MetricRecord(timestamp2, 90.0),
+        )),
+        InstanceMetricData("id4", ()),
+    )
+
+
+  def testAggregateStatisticsEmpty(self):
+    result = aggregation.aggregateStatistics(())
+    self.assertSequenceEqual(result.timestamps, ())
+    for values in result.values.itervalues():
+      self.assertEqual(len(values), 0)
+
+    result = aggregation.aggregateStatistics(
+      (InstanceMetricData("id", ()),), missingPolicy=MissingPolicy.ZERO)
+    self.assertSequenceEqual(result.timestamps, ())
+
+
+  def testAggregateStatisticsBasicIgnoreMissing(self):
+    result = aggregation.aggregateStatistics(self.slices)
+
+    self.assertSequenceEqual(result.timestamps, self.timestamps)
+    self.assertSequenceEqual(result.values["sum"].tolist(), (50.0, 160.0, 90.0))
+    self.assertSequenceEqual(result.values["mean"].tolist(),
+                             (25.0, 160.0 / 3, 45.0))
+    self.assertSequenceEqual(result.values["min"].tolist(), (10.0, 20.0, 30.0))
+    self.assertSequenceEqual(result.values["max"].tolist(), (40.0, 90.0, 60.0))
+    self.assertSequenceEqual(result.values["count"].tolist(), (2.0, 3.0, 2.0))
+
+
+  def testAggregateStatisticsPercentiles(self):
+    result = aggregation.aggregateStatistics(
+      self.slices, statistics=("p0", "p50", "p100", "p75"))
+
+    self.assertSequenceEqual(result.values["p0"].tolist(), (10.0, 20.0, 30.0))
+    self.assertSequenceEqual(result.values["p50"].tolist(), (25.0, 50.0, 45.0))
+    self.assertSequenceEqual(result.values["p100"].tolist(),
+                             (40.0, 90.0, 60.0))
+    self.assertSequenceEqual(result.values["p75"].tolist(),
+                             (32.5, 70.0, 52.5))
+
+
+  def testAggregateStatisticsMatchesLegacyAggregate(self):
+    self.assertSequenceEqual(
+      aggregation.aggregateStatistic(self.slices),
+      aggregation.aggregate(self.slices))
+
+    self.assertSequenceEqual(
+      aggregation.aggregateStatistic(self.slices, statistic="sum"),
+      aggregation.aggregate(self.slices, aggregationFn=sum))
+
+
+  def testAggregateStatisticsMissingZero(self):
+    result = aggregation.aggregateStatistics(
+      self.slices, statistics=("mean", "min", "count"),
+      missingPolicy=MissingPolicy.ZERO)
+
+    self.assertSequenceEqual(result.timestamps, self.timestamps)
+    self.assertSequenceEqual(result.values["mean"].tolist(),
+                             (12.5, 40.0, 22.5))
+    self.assertSequenceEqual(result.values["min"].tolist(), (0.0, 0.0, 0.0))
+    self.assertSequenceEqual(result.values["count"].tolist(), (4.0, 4.0, 4.0))
+
+
+  def testAggregateStatisticsMissingPrevious(self):
+    result = aggregation.aggregateStatistics(
+      self.slices, statistics=("sum", "count"),
+      missingPolicy=MissingPolicy.PREVIOUS)
+
+    self.assertSequenceEqual(result.timestamps, self.timestamps)
+    # id3 has nothing to carry forward at timestamp1, but its timestamp2 value
+    # is carried forward to timestamp3
+    self.assertSequenceEqual(result.values["sum"].tolist(),
+                             (50.0, 160.0, 180.0))
+    self.assertSequenceEqual(result.values["count"].tolist(), (2.0, 3.0, 3.0))
+
+
+  def testAggregateStatisticsMissingDrop(self):
+    slices = self.slices[:3]
+    result = aggregation.aggregateStatistics(
+      slices, statistics=("max",), missingPolicy=MissingPolicy.DROP)
+
+    self.assertSequenceEqual(result.timestamps, self.timestamps[1:2])
+    self.assertSequenceEqual(result.values["max"].tolist(), (90.0,))
+
+    # An instance without any data causes all buckets to be dropped
+    result = aggregation.aggregateStatistics(
+      self.slices, statistics=("max",), missingPolicy=MissingPolicy.DROP)
+    self.assertSequenceEqual(result.timestamps, ())
+
+
+  def testAggregateStatisticsInvalidArgs(self):
+    with self.assertRaises(ValueError):
+      aggregation.aggregateStatistics(self.slices, statistics=("median",))
+
+    with self.assertRaises(ValueError):
+      aggregation.aggregateStatistics(self.slices, statistics=("p101",))
+
+    with self.assertRaises(ValueError):
+      aggregation.aggregateStatistics(self.slices, missingPolicy="interpolate")
+
+
+
 class GetStatisticsTest(unittest.TestCase):
   """Unit tests for the getStatistics function."""
 
+  def setUp(self):
+    # Give each test its own metric getter service
+    serviceP = patch.object(aggregation, "_metricGetterService",
+                            aggregation._MetricGetterService())
+    serviceP.start()
+    self.addCleanup(serviceP.stop)
+
+
   @patch("htm.it.app.runtime.aggregation.repository")
   @patch("htm.it.app.runtime.aggregation.EC2InstanceMetricGetter")
   def testGetStatisticsNoData(self, ec2InstanceMetricGetterMock,
@@ -171,11 +306,15 @@ class GetStatisticsTest(unittest.TestCase):
     class MetricRowSpec(object):
       uid = None
       datasource = None
+      name = None
+      poll_interval = None
 
     metricRowMock = Mock(
         spec_set=MetricRowSpec,
         uid=metricID,
-        datasource="autostack")
+        datasource="autostack",
+        name="AWS/EC2/CPUUtilization",
+        poll_interval=300)
     autostackMock = Mock()
     repositoryMock.getAutostackFromMetric = Mock(return_value=autostackMock)
     repositoryMock.getMetricStats.side_effect = MetricStatisticsNotReadyError()
@@ -193,7 +332,8 @@ class GetStatisticsTest(unittest.TestCase):
 
     metricGetterMock.collectMetricStatistics.assert_called_once_with(
         autostackMock, metricRowMock)
-    metricGetterMock.close.assert_called_once_with()
+    # The metric getter is reused across calls
+    self.assertFalse(metricGetterMock.close.called)
 
 
   @patch("htm.it.app.runtime.aggregation.repository")
@@ -204,11 +344,15 @@ class GetStatisticsTest(unittest.TestCase):
     class MetricRowSpec(object):
       uid = None
       datasource = None
+      name = None
+      poll_interval = None
 
     metricRowMock = Mock(
         spec_set=MetricRowSpec,
         uid=metricID,
-        datasource="autostack")
+        datasource="autostack",
+        name="AWS/EC2/CPUUtilization",
+        poll_interval=300)
 
     autostackMock = Mock()
     repositoryMock.getAutostackFromMetric = Mock(return_value=autostackMock)
@@ -237,7 +381,8 @@ class GetStatisticsTest(unittest.TestCase):
 
     metricGetterMock.collectMetricStatistics.assert_called_once_with(
         autostackMock, metricRowMock)
-    metricGetterMock.close.assert_called_once_with()
+    # The metric getter is reused across calls
+    self.assertFalse(metricGetterMock.close.called)
 
 
   @patch("htm.it.app.runtime.aggregation.repository.engineFactory", autospec=True)
@@ -251,10 +396,14 @@ class GetStatisticsTest(unittest.TestCase):
     class MetricRowSpec(object):
       uid = None
       datasource = None
+      name = None
+      poll_interval = None
     metricRowMock = Mock(
         spec_set=MetricRowSpec,
         uid=metricID,
-        datasource="autostack")
+        datasource="autostack",
+        name="AWS/EC2/CPUUtilization",
+        poll_interval=300)
     autostackMock = Mock()
     getAutostackFromMetricMock.return_value = autostackMock
 
@@ -285,9 +434,99 @@ class GetStatisticsTest(unittest.TestCase):
 
     metricGetterMock.collectMetricStatistics.assert_called_once_with(
         autostackMock, metricRowMock)
+    # The metric getter is reused across calls
+    self.assertFalse(metricGetterMock.close.called)
+
+
+  @patch("htm.it.app.runtime.aggregation.repository")
+  @patch("htm.it.app.runtime.aggregation.EC2InstanceMetricGetter")
+  def testGetStatisticsReusesMetricGetterAndCachesStats(
+      self, ec2InstanceMetricGetterMock, repositoryMock):
+    class MetricRowSpec(object):
+      uid = None
+      datasource = None
+      name = None
+      poll_interval = None
+
+    metricRowMock = Mock(
+        spec_set=MetricRowSpec,
+        uid="abc",
+        datasource="autostack",
+        name="AWS/EC2/CPUUtilization",
+        poll_interval=300)
+    otherMetricRowMock = Mock(
+        spec_set=MetricRowSpec,
+        uid="def",
+        datasource="autostack",
+        name="AWS/EC2/NetworkIn",
+        poll_interval=300)
+
+    autostackMock = Mock(uid="stack1")
+    repositoryMock.getAutostackFromMetric = Mock(return_value=autostackMock)
+
+    metricGetterMock = Mock()
+    ec2InstanceMetricGetterMock.return_value = metricGetterMock
+    metricGetterMock.collectMetricStatistics.return_value = [
+        InstanceMetricData(
+            instanceID="tempID",
+            records=[MetricRecord(timestamp=None,
+                                  value={"min": 5.0, "max": 20.0})]),
+    ]
+
+    # Call the function under test repeatedly
+    stats1 = aggregation.getStatistics(metricRowMock)
+    stats2 = aggregation.getStatistics(metricRowMock)
+    aggregation.getStatistics(otherMetricRowMock)
+
+    self.assertEqual(stats1, stats2)
+
+    # Only one metric getter was created and stats for the repeated metric
+    # were collected only once
+    ec2InstanceMetricGetterMock.assert_called_once_with()
+    self.assertEqual(metricGetterMock.collectMetricStatistics.call_count, 2)
+    self.assertFalse(metricGetterMock.close.called)
+
+    aggregation._metricGetterService.close()
     metricGetterMock.close.assert_called_once_with()
 
 
+  @patch("htm.it.app.runtime.aggregation.time", autospec=True)
+  @patch("htm.it.app.runtime.aggregation.EC2InstanceMetricGetter")
+  def testMetricGetterServiceStatsExpire(self, ec2InstanceMetricGetterMock,
+                                         timeMock):
+    service = aggregation._MetricGetterService(statsCacheTTLSec=60)
+    metricMock = Mock(name="metric", poll_interval=300)
+    autostackMock = Mock(uid="stack1")
+
+    metricGetterMock = ec2InstanceMetricGetterMock.return_value
+    metricGetterMock.collectMetricStatistics.return_value = [Mock()]
+
+    timeMock.time.return_value = 1000
+    service.collectMetricStatistics(autostackMock, metricMock)
+    timeMock.time.return_value = 1059
+    service.collectMetricStatistics(autostackMock, metricMock)
+    self.assertEqual(metricGetterMock.collectMetricStatistics.call_count, 1)
+
+    timeMock.time.return_value = 1060
+    service.collectMetricStatistics(autostackMock, metricMock)
+    self.assertEqual(metricGetterMock.collectMetricStatistics.call_count, 2)
+
+
+  @patch("htm.it.app.runtime.aggregation.EC2InstanceMetricGetter")
+  def testMetricGetterServiceDoesNotCacheEmptyStats(
+      self, ec2InstanceMetricGetterMock):
+    service = aggregation._MetricGetterService()
+    metricMock = Mock(name="metric", poll_interval=300)
+    autostackMock = Mock(uid="stack1")
+
+    metricGetterMock = ec2InstanceMetricGetterMock.return_value
+    metricGetterMock.collectMetricStatistics.return_value = []
+
+    service.collectMetricStatistics(autostackMock, metricMock)
+    service.collectMetricStatistics(autostackMock, metricMock)
+    self.assertEqual(metricGetterMock.collectMetricStatistics.call_count, 2)
+
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -26,6 +26,7 @@
 # pylint: disable=W0212
 
 import datetime
+import json
 import unittest
 
 from mock import Mock, patch
@@ -57,6 +58,7 @@ class AggregatorServiceTestCase(unittest.TestCase):
       server = None
       status = None
       last_timestamp = None
+      parameters = None
 
     class AutostackRowSpec(object):
       uid = "def"
@@ -155,8 +157,8 @@ class AggregatorServiceTestCase(unittest.TestCase):
       lambda data, *args, **kwargs: streamedData.append(data))
 
     aggSvc = aggregator_service.AggregatorService()
-    with patch.object(aggregator_service, "getAggregationFn", autospec=True,
-                      return_value=None):
+    with patch.object(aggregator_service, "getAggregationSpec", autospec=True,
+                      return_value=("mean", "ignore")):
       aggSvc._processAutostackMetricRequests(
         engine=engineMock,
         requests=requests,
@@ -167,6 +169,25 @@ class AggregatorServiceTestCase(unittest.TestCase):
     self.assertEqual(streamedData[0][0][1], okDataValue)
 
 
+  def testGetAggregationSpec(self):
+    metric = Mock(spec_set=self.MetricRowSpec)
+    metric.name = "AWS/EC2/CPUUtilization"
+
+    # Default for metrics that aren't queried with the Sum statistic
+    metric.parameters = json.dumps(
+      {"metricSpec": {"slaveDatasource": "cloudwatch"}})
+    self.assertEqual(aggregator_service.getAggregationSpec(metric),
+                     ("mean", "ignore"))
+
+    # Explicit aggregation spec
+    metric.parameters = json.dumps(
+      {"metricSpec": {"slaveDatasource": "cloudwatch",
+                      "aggregation": {"statistic": "p95",
+                                      "missingPolicy": "previous"}}})
+    self.assertEqual(aggregator_service.getAggregationSpec(metric),
+                     ("p95", "previous"))
+
+
 
 if __name__ == "__main__":
   unittest.main()
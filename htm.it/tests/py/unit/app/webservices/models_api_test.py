@@ -784,6 +784,32 @@ class TestMetricDataHandler(unittest.TestCase):
       "anomaly_score", "rowid"])
 
 
+  @patch("htm.it.app.webservices.models_api.repository.getMetricData")
+  def testQueryMultiMetricAsBinaryStreamWithLimit(self, getMetricDataMock,
+                                                  _engineMock):
+    self.headers["Accept"] = "application/octet-stream"
+
+    rows = self.decodeRowTuples(self.metric_data["datalist"])
+    otherRows = [row._replace(uid="other") for row in rows]
+    getMetricDataMock.return_value = rows + otherRows
+
+    response = self.app.get("/data?limit=2", headers=self.headers)
+
+    unpacker = msgpack.Unpacker(StringIO.StringIO(response.body))
+
+    names = next(unpacker)
+    self.assertEqual(names, ["names", "uid", "timestamp", "value",
+      "anomaly_score", "rowid"])
+
+    # At most `limit` rows per metric
+    results = list(unpacker)
+    self.assertEqual([result[0] for result in results],
+                     [rows[0].uid, rows[0].uid, "other", "other"])
+    self.assertEqual([result[4] for result in results],
+                     [rows[0].rowid, rows[1].rowid,
+                      rows[0].rowid, rows[1].rowid])
+
+
 
 @patch.object(repository, "engineFactory", autospec=True)
 class TestModelExportHandler(unittest.TestCase):
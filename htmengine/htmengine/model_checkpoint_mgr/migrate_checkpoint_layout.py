@@ -0,0 +1,77 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""Convert the model checkpoint archive from the flat layout, with the entries
+of all models in the root directory, to the hashed layout, with the entries in
+two levels of shard directories. The archive remains usable by running
+services during the migration; an interrupted migration is resumed by running
+this tool again.
+"""
+
+import argparse
+import logging
+import sys
+
+from nta.utils.error_handling import logExceptions
+from nta.utils.logging_support_raw import LoggingSupport
+
+from htmengine.model_checkpoint_mgr.model_checkpoint_mgr import (
+  ModelCheckpointMgr)
+
+
+
+g_log = logging.getLogger(__name__)
+
+
+
+def _parseArgs(args):
+  """Parse command-line arguments
+
+  :param list args: the equivalent of sys.argv[1:]
+
+  :returns: the args object generated by ``argparse.ArgumentParser.parse_args``
+  """
+  parser = argparse.ArgumentParser(description=__doc__)
+
+  return parser.parse_args(args)
+
+
+
+@logExceptions(g_log)
+def main():
+  try:
+    _parseArgs(sys.argv[1:])
+  except SystemExit as exc:
+    if exc.code == 0:
+      # Suppress exception logging when exiting due to --help
+      return
+
+    raise
+
+  numMigrated = ModelCheckpointMgr().migrateToHashedLayout()
+  g_log.info("Moved %d model entries to the hashed layout", numMigrated)
+
+
+
+if __name__ == "__main__":
+  LoggingSupport.initTool()
+
+  main()
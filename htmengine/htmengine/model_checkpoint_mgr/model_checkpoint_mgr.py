@@ -24,14 +24,23 @@ This module implements the Model Checkpoint Manager that's responsible for
 saving and loading models to persistent storage.
 """
 
+import contextlib
 import errno
+import fcntl
+import hashlib
 import json
 import os
 import shutil
+import struct
+import sys
 import tempfile
+import threading
 import time
+import uuid
+import zlib
 
 from nupic.frameworks.opf.modelfactory import ModelFactory
+from nupic.support.decorators import logExceptions
 
 from htmengine import htmengine_logging
 
@@ -78,6 +87,95 @@ def _getLogger():
 
 
 
+class _RetiredTreeReaper(object):
+  """ Deletes the directory trees that ModelCheckpointMgr retires (old
+  checkpoint stores and removed model entries) in a background thread, so that
+  save() and remove() don't wait for them to be deleted.
+
+  The queue is the retired directory of the archive itself: trees are renamed
+  into it atomically, so a tree that wasn't deleted before the process exited
+  or crashed, including a partially deleted one, is deleted on the next pass
+  over the directory by any process that uses the archive.
+  """
+
+  _singleton = None
+  _singletonLock = threading.Lock()
+
+
+  @classmethod
+  def notify(cls, retiredDirPath):
+    """ [thread-safe] Schedule a pass over the given retired directory in the
+    background thread of the process, starting the thread if needed
+    """
+    with cls._singletonLock:
+      if cls._singleton is None:
+        cls._singleton = cls()
+
+    cls._singleton._schedule(retiredDirPath)  # pylint: disable=W0212
+
+
+  @classmethod
+  def reap(cls, retiredDirPath):
+    """ [thread-safe] Delete the trees in the given retired directory in the
+    calling thread
+
+    :returns: number of trees deleted
+    """
+    try:
+      names = os.listdir(retiredDirPath)
+    except OSError as e:
+      if e.errno == errno.ENOENT:
+        # The whole archive was removed
+        return 0
+      raise
+
+    def onError(_func, path, excInfo):
+      # Trees may be deleted concurrently by other threads or processes
+      if not (isinstance(excInfo[1], EnvironmentError) and
+              excInfo[1].errno == errno.ENOENT):
+        _getLogger().warning("Failed to delete retired path=%s: %r; will "
+                             "retry on the next pass", path, excInfo[1])
+
+    for name in names:
+      shutil.rmtree(os.path.join(retiredDirPath, name), onerror=onError)
+
+    return len(names)
+
+
+  def __init__(self):
+    self._cond = threading.Condition()
+    self._pendingDirPaths = set()
+
+    self._reaperThread = threading.Thread(target=self._runReaperThread,
+                                          name="checkpoint-reaper")
+    # Allow process to exit even if thread is still running; the remaining
+    # trees are deleted later
+    self._reaperThread.setDaemon(True)
+    self._reaperThread.start()
+
+
+  def _schedule(self, retiredDirPath):
+    with self._cond:
+      self._pendingDirPaths.add(retiredDirPath)
+      self._cond.notify()
+
+
+  @logExceptions(_getLogger)
+  def _runReaperThread(self):
+    while True:
+      with self._cond:
+        while not self._pendingDirPaths:
+          self._cond.wait()
+        retiredDirPath = self._pendingDirPaths.pop()
+
+      try:
+        self.reap(retiredDirPath)
+      except Exception:  # pylint: disable=W0703
+        _getLogger().exception("Failed to reap retired directory=%s",
+                               retiredDirPath)
+
+
+
 class ModelCheckpointMgr(object):
   """
   Goal: saving of model definitions, checkpoints and attributes must be atomic -
@@ -87,14 +185,22 @@ class ModelCheckpointMgr(object):
 
   ModelCheckpointMgr internals documentation:
 
-  Model Checkpoint archive layout: the top level directory names are the model
-  IDs (e.g., 1ebd2d27dfd74cd98f96220721b9a257). The following example
-  demonstrates the layout of a model entry in this archive:
+  Model Checkpoint archive layout: in the original flat layout, the top level
+  directory names are the model IDs (e.g., 1ebd2d27dfd74cd98f96220721b9a257).
+  In the hashed layout, each model entry is in two levels of shard directories
+  named after the leading hex digits of the MD5 digest of the model ID (e.g.,
+  3f/a/1ebd2d27dfd74cd98f96220721b9a257), so that no directory grows with the
+  number of models. The layout version is recorded in the .layout file at the
+  top level; an archive without it has the flat layout. A flat archive is
+  converted online by migrateToHashedLayout(), during which model entries are
+  looked up in both layouts. The following example demonstrates the layout of
+  a model entry in this archive:
 
   1ebd2d27dfd74cd98f96220721b9a257
     definition.data
     version.txt
-    current_checkpoint --> (a link to checkpoint_store_<timestamp> dir)
+    current_checkpoint --> (a link to checkpoint_store_<timestamp> dir; only
+      the name of the link target is used, so that the entry may be moved)
 
     checkpoint_store_1389761327.552464/ (seconds since epoch as suffix)
       attributes.data
@@ -104,6 +210,50 @@ class ModelCheckpointMgr(object):
           TemporalAnomaly-network.nta/
             R0-pkl
             . . .
+    checkpoint_store_1389761327.552464.log (optional input log of the
+      checkpoint)
+
+  The input log of a checkpoint holds the records that appendCheckpointLog()
+  appended since the checkpoint was saved, each as a header with the byte
+  length and the CRC-32 of the record followed by the record; a record that
+  was torn by a crash is discarded when the log is read.
+
+  Files in the archive other than input logs are never modified in place: each
+  checkpoint is saved to a new checkpoint store and attributes files are
+  replaced by renaming. So clone() shares the files of the source entry with
+  hard links, or reflinks, and copies them only if the filesystem supports
+  neither; the input log is always copied. Checkpoint stores that are no longer
+  current, with their input logs, and removed model entries are renamed into
+  the .retired directory at the top level and deleted by a background thread;
+  stores that a crash left behind in a model entry are retired by the next
+  save() of the model.
+
+  Optional RAM tier: when the ram_root option of model-checkpoint.conf is set,
+  save() writes the checkpoint store without fsync to that directory, which
+  should be on a RAM-backed filesystem, and marks the model dirty there;
+  load() and the attribute methods use the RAM tier's checkpoint while it's at
+  least as new as the archive's. RamTierFlusher, which runs in the model
+  scheduler service, persists the dirty checkpoints to the archive with the
+  full fsync and evicts the least recently saved clean ones. Model entries
+  (definitions) and input logs are always in the archive only; the input log
+  of a checkpoint in the RAM tier is named after its store, which keeps its
+  name when it's persisted. The RAM tier is:
+
+  <ram_root>
+    .dirty/<model ID> (marker of an unpersisted checkpoint; mtime is the time
+      of the oldest unpersisted save)
+    .locks/<model ID> (flock() of a model's RAM tier entry)
+    .scratch/
+    <model ID>/
+      current_checkpoint --> checkpoint_store_<timestamp>
+      checkpoint_store_<timestamp>/ (same as in the archive)
+
+  Durability window: a checkpoint in the RAM tier survives restarts of the
+  services, but not of the host. Once a dirty marker is older than
+  ram_max_flush_lag_sec (the flusher is behind or not running), save() writes
+  to the archive directly, so that a host crash loses at most the checkpoints
+  that were saved during the ram_max_flush_lag_sec before the flusher stopped
+  keeping up.
   """
 
 
@@ -116,6 +266,11 @@ class ModelCheckpointMgr(object):
   # to be "moved" efficiently simply by renaming its path
   _SCRATCH_DIR_NAME = ".scratch"
 
+  # Root-level directory of the checkpoint stores and model entries that are
+  # waiting to be deleted by _RetiredTreeReaper; in the same filesystem for
+  # the same reason as the scratch directory
+  _RETIRED_DIR_NAME = ".retired"
+
   # The filename that contains the model archive version; located at top level
   # of each model's archive
   _MODEL_ENTRY_VERSION_FILE_NAME = "version.txt"
@@ -141,6 +296,70 @@ class ModelCheckpointMgr(object):
   # actual model checkpoint store directory
   _CHECKPOINT_INSTANCE_DIR_NAME = "model_instance"
 
+  # The input log of a checkpoint store is the file named after the store with
+  # this suffix; located at top level of each model's archive
+  _CHECKPOINT_LOG_FILE_NAME_SUFFIX = ".log"
+
+  # Header of each record of an input log: byte length and CRC-32 of the
+  # record
+  _CHECKPOINT_LOG_RECORD_HEADER = struct.Struct("!II")
+
+  # JSON file with the layout version of the archive; located in the root
+  # storage directory. Absent in archives of the flat layout
+  _LAYOUT_FILE_NAME = ".layout"
+
+  # Archive layout versions: model entries directly in the root storage
+  # directory or in the shard directories of the hashed layout
+  _FLAT_LAYOUT_VERSION = 1
+  _HASHED_LAYOUT_VERSION = 2
+
+  # Values of the "layout" option of model-checkpoint.conf, which selects the
+  # layout of a new archive
+  _LAYOUT_VERSIONS_BY_NAME = {
+    "flat": _FLAT_LAYOUT_VERSION,
+    "hashed": _HASHED_LAYOUT_VERSION
+  }
+
+  # Number of hex digits of the model ID's MD5 digest that name the shard
+  # directory of each level of the hashed layout: 256 top-level directories of
+  # up to 16 directories each keep the directories small up to millions of
+  # models, while getModelIDs() lists only a few thousand directories
+  _HASHED_LAYOUT_SHARD_WIDTHS = (2, 1)
+
+  # Log migration progress every this many model entries
+  _MIGRATION_PROGRESS_INTERVAL = 10000
+
+  # Linux ioctl request that makes a file share the data blocks of another
+  # file on filesystems with copy-on-write support, such as btrfs and XFS
+  _FICLONE_IOCTL = 0x40049409
+
+  # Errors of link(2) and of the FICLONE ioctl when the filesystem doesn't
+  # support sharing the file
+  _FILE_SHARING_UNSUPPORTED_ERRNOS = frozenset([
+    errno.EPERM, errno.EXDEV, errno.EMLINK, errno.EOPNOTSUPP, errno.ENOTTY,
+    errno.EINVAL, errno.ENOSYS])
+
+  # Directories of the RAM tier with the dirty markers and the lock files of
+  # the models
+  _RAM_TIER_DIRTY_DIR_NAME = ".dirty"
+  _RAM_TIER_LOCK_DIR_NAME = ".locks"
+
+  # Defaults of the ram_max_flush_lag_sec and ram_max_models options
+  _DEFAULT_RAM_TIER_MAX_FLUSH_LAG_SEC = 30
+  _DEFAULT_RAM_TIER_MAX_MODELS = 1000
+
+  # Lock file of the RAM tier that serializes flushes; not a model ID
+  _RAM_TIER_FLUSH_LOCK_NAME = ".flush"
+
+  # Actions of flushRamTier() for a model's entry in the RAM tier
+  _RAM_TIER_PERSIST_CHECKPOINT = "persistCheckpoint"
+  _RAM_TIER_PERSIST_ATTRIBUTES = "persistAttributes"
+  _RAM_TIER_DROP = "drop"
+
+  # Temporary directories of the RAM tier that are older than this are left
+  # by crashed processes and deleted by flushRamTier()
+  _RAM_TIER_SCRATCH_MAX_AGE_SEC = 3600
+
 
   def __init__(self):
     self._logger = _getLogger()
@@ -157,6 +376,61 @@ class ModelCheckpointMgr(object):
     if not os.path.exists(self._scratchDir):
       makeDirectoryFromAbsolutePath(self._scratchDir)
 
+    self._retiredDir = os.path.join(self._storageRoot, self._RETIRED_DIR_NAME)
+    if not os.path.exists(self._retiredDir):
+      makeDirectoryFromAbsolutePath(self._retiredDir)
+
+    # Delete what was retired, but not deleted, before a crash or restart
+    _RetiredTreeReaper.notify(self._retiredDir)
+
+    # Whether clone() may try to share files by hard links and reflinks;
+    # cleared when the filesystem turns out not to support them
+    self._canHardLink = True
+    self._canReflink = sys.platform.startswith("linux")
+
+    # Byte lengths of the intact records of the input logs that this instance
+    # read or appended to, by path; appendCheckpointLog() checks for a torn
+    # record at the end of a log that isn't in here
+    self._checkpointLogSizes = dict()
+
+    # The optional RAM tier; self._ramRoot is None if checkpoints are saved
+    # directly to the archive
+    (self._ramRoot,
+     self._ramMaxFlushLagSec,
+     self._ramMaxModels) = self._getRamTierConfig()
+
+    if self._ramRoot is not None:
+      self._logger.debug("Using RAM tier root=%s", self._ramRoot)
+
+      self._ramScratchDir = os.path.join(self._ramRoot, self._SCRATCH_DIR_NAME)
+      self._ramDirtyDir = os.path.join(self._ramRoot,
+                                       self._RAM_TIER_DIRTY_DIR_NAME)
+      self._ramLockDir = os.path.join(self._ramRoot,
+                                      self._RAM_TIER_LOCK_DIR_NAME)
+      for dirPath in (self._ramScratchDir, self._ramDirtyDir,
+                      self._ramLockDir):
+        if not os.path.exists(dirPath):
+          makeDirectoryFromAbsolutePath(dirPath)
+
+    # Layout of the archive per the layout file; the target version of the
+    # migration in progress, if any
+    self._layoutVersion = None
+    self._migratingToVersion = None
+    self._loadLayout()
+
+    if (self._layoutVersion == self._FLAT_LAYOUT_VERSION and
+        self._migratingToVersion is None and
+        self._getConfiguredLayoutVersion() == self._HASHED_LAYOUT_VERSION):
+      if not self._listFlatModelEntries():
+        # Start the new archive with the hashed layout
+        self._saveLayout(self._HASHED_LAYOUT_VERSION)
+      else:
+        self._logger.warning(
+          "Hashed layout is configured, but the model checkpoint archive at "
+          "%s has the flat layout; convert it with "
+          "htmengine.model_checkpoint_mgr.migrate_checkpoint_layout",
+          self._storageRoot)
+
 
   @classmethod
   def _getStorageRoot(cls):
@@ -170,46 +444,282 @@ class ModelCheckpointMgr(object):
     return os.path.realpath(storageRoot)
 
 
+  @classmethod
+  def _getRamTierConfig(cls):
+    """ Get the RAM tier options of model-checkpoint.conf
+
+    :returns: (ramRoot, maxFlushLagSec, maxModels); (None, None, None) if the
+      optional ram_root option is omitted or empty
+    """
+    config = ModelCheckpointConfig()
+    if (not config.has_option("storage", "ram_root") or
+        not config.get("storage", "ram_root").strip()):
+      return None, None, None
+
+    ramRoot = os.path.expanduser(os.path.expandvars(
+      config.get("storage", "ram_root").strip()))
+    if not os.path.isabs(ramRoot):
+      raise ValueError("Model Checkpoint RAM tier root path is not absolute: "
+                       "%r" % (ramRoot,))
+
+    maxFlushLagSec = cls._DEFAULT_RAM_TIER_MAX_FLUSH_LAG_SEC
+    if config.has_option("storage", "ram_max_flush_lag_sec"):
+      maxFlushLagSec = config.getfloat("storage", "ram_max_flush_lag_sec")
+
+    maxModels = cls._DEFAULT_RAM_TIER_MAX_MODELS
+    if config.has_option("storage", "ram_max_models"):
+      maxModels = config.getint("storage", "ram_max_models")
+
+    if maxFlushLagSec <= 0 or maxModels <= 0:
+      raise ValueError("Model Checkpoint RAM tier ram_max_flush_lag_sec=%r and "
+                       "ram_max_models=%r must be positive" %
+                       (maxFlushLagSec, maxModels))
+
+    return os.path.realpath(ramRoot), maxFlushLagSec, maxModels
+
+
+  @classmethod
+  def isRamTierEnabled(cls):
+    """ Whether model-checkpoint.conf configures the RAM tier, which needs a
+    RamTierFlusher to persist its checkpoints
+    """
+    return cls._getRamTierConfig()[0] is not None
+
+
+  @classmethod
+  def _getConfiguredLayoutVersion(cls):
+    """ Get the layout version for a new archive per the optional "layout"
+    option of model-checkpoint.conf; flat if omitted
+    """
+    config = ModelCheckpointConfig()
+    if not config.has_option("storage", "layout"):
+      return cls._FLAT_LAYOUT_VERSION
+
+    layout = config.get("storage", "layout")
+    try:
+      return cls._LAYOUT_VERSIONS_BY_NAME[layout]
+    except KeyError:
+      raise ValueError("Unknown model checkpoint archive layout=%r; expected "
+                       "one of %s" % (layout,
+                                      sorted(cls._LAYOUT_VERSIONS_BY_NAME)))
+
+
+  def _loadLayout(self):
+    """ Load the layout of the archive from the layout file
+
+    :returns: True if the layout changed since it was last loaded
+    :raises ValueError: if the layout version isn't supported
+    """
+    layoutFilePath = os.path.join(self._storageRoot, self._LAYOUT_FILE_NAME)
+    try:
+      with open(layoutFilePath) as fileObj:
+        layout = json.load(fileObj)
+    except IOError as e:
+      if e.errno != errno.ENOENT:
+        raise
+      layout = {"layoutVersion": self._FLAT_LAYOUT_VERSION}
+
+    layoutVersion = layout["layoutVersion"]
+    migratingToVersion = layout.get("migratingToVersion")
+
+    supportedVersions = (self._FLAT_LAYOUT_VERSION, self._HASHED_LAYOUT_VERSION)
+    if (layoutVersion not in supportedVersions or
+        migratingToVersion not in supportedVersions + (None,)):
+      raise ValueError("Unsupported model checkpoint archive layout=%r at %s" %
+                       (layout, self._storageRoot))
+
+    changed = ((layoutVersion, migratingToVersion) !=
+               (self._layoutVersion, self._migratingToVersion))
+
+    self._layoutVersion = layoutVersion
+    self._migratingToVersion = migratingToVersion
+
+    return changed
+
+
+  def _saveLayout(self, layoutVersion, migratingToVersion=None):
+    """ Atomically replace the layout file """
+    layout = {"layoutVersion": layoutVersion}
+    if migratingToVersion is not None:
+      layout["migratingToVersion"] = migratingToVersion
+
+    (tempFd, tempPath) = tempfile.mkstemp(suffix=self._LAYOUT_FILE_NAME,
+                                          dir=self._scratchDir,
+                                          text=False)
+
+    with os.fdopen(tempFd, "wb") as fileObj:
+      json.dump(layout, fileObj)
+      fileObj.flush()
+      self._fsyncReliably(tempFd)
+
+    os.rename(tempPath,
+              os.path.join(self._storageRoot, self._LAYOUT_FILE_NAME))
+    self._fsyncDirectoryOnly(self._storageRoot)
+
+    self._layoutVersion = layoutVersion
+    self._migratingToVersion = migratingToVersion
+
+    self._logger.info("Model checkpoint archive layout of %s is now %r",
+                      self._storageRoot, layout)
+
+
+  def _getFlatModelDir(self, modelID):
+    return os.path.join(self._storageRoot, modelID)
+
+
+  def _getHashedModelDir(self, modelID):
+    digest = hashlib.md5(modelID).hexdigest()
+
+    shardNames = []
+    offset = 0
+    for width in self._HASHED_LAYOUT_SHARD_WIDTHS:
+      shardNames.append(digest[offset:offset + width])
+      offset += width
+
+    return os.path.join(self._storageRoot, *(shardNames + [modelID]))
+
+
+  def _getModelDirCandidates(self, modelID):
+    """ Get the paths at which the model entry may be per the current layout,
+    in lookup order; the first one is the location of a new entry
+    """
+    if self._migratingToVersion is not None:
+      # Look up the new location again after the old one, in case the entry was
+      # migrated in between
+      hashedPath = self._getHashedModelDir(modelID)
+      return (hashedPath, self._getFlatModelDir(modelID), hashedPath)
+    elif self._layoutVersion == self._HASHED_LAYOUT_VERSION:
+      return (self._getHashedModelDir(modelID),)
+    else:
+      return (self._getFlatModelDir(modelID),)
+
+
   def _getModelDir(self, modelID, mustExist):
     """ Get the directory path of the model entry
 
     param modelID: model ID of the model
     param mustExist: If true, and the directory does not exist, raise a
       ModelNotFound exception
+
+    returns: the path of the existing entry or, if it doesn't exist and
+      mustExist is False, the path of a new entry per the current layout
     """
+    while True:
+      candidates = self._getModelDirCandidates(modelID)
+      for modelRootPath in candidates:
+        if os.path.exists(modelRootPath):
+          return modelRootPath
+
+      # The layout may have been changed by a migration in another process
+      if not self._loadLayout():
+        break
 
-    modelRootPath = os.path.join(self._storageRoot, modelID)
-    if mustExist and not os.path.exists(modelRootPath):
+    if mustExist:
       raise ModelNotFound("Model archive not found for model=%s" % (modelID,))
 
-    return modelRootPath
+    return candidates[0]
 
 
-  def _getCurrentCheckpointRealPath(self, modelID):
-    """ Get the real path of the model's existing checkpoint store directory,
-    resolving all links
+  def _callWithModelEntry(self, modelID, func):
+    """ Call func with the directory path of the model entry; if it fails
+    because the entry was moved by a layout migration in the meantime, call it
+    again with the new path
+
+    :param modelID: model ID of the model
+    :param func: function that takes the directory path of the model entry;
+      it must be safe to call it again after such a failure
+
+    :returns: the return value of func
+    :raises: ModelNotFound if the model entry doesn't exist
+    """
+    modelEntryDirPath = self._getModelDir(modelID, mustExist=True)
+    try:
+      return func(modelEntryDirPath)
+    except (ModelNotFound, EnvironmentError) as e:
+      if isinstance(e, EnvironmentError) and e.errno != errno.ENOENT:
+        raise
+
+      excInfo = sys.exc_info()
+
+      try:
+        movedModelEntryDirPath = self._getModelDir(modelID, mustExist=True)
+      except ModelNotFound:
+        movedModelEntryDirPath = None
+
+      if movedModelEntryDirPath in (None, modelEntryDirPath):
+        raise excInfo[0], excInfo[1], excInfo[2]
+
+      self._logger.info("Model entry of model=%s moved to %s; retrying",
+                        modelID, movedModelEntryDirPath)
+
+    return func(movedModelEntryDirPath)
+
+
+  def _getCheckpointStoreDirPath(self, modelID, modelEntryDirPath):
+    """ Get the path of the model's current checkpoint store directory
 
     raises:
-      ModelNotFound if the model checkpoint hasn't been saved yet or if this
-        model's entry doesn't exist in the checkpoint archive
+      ModelNotFound if the model checkpoint hasn't been saved yet or if the
+        model entry doesn't exist
     """
-    currentStoreSymlinkPath = os.path.join(
-      self._getModelDir(modelID, mustExist=True),
-      self._CHECKPOINT_LINK_NAME)
+    currentStoreSymlinkPath = os.path.join(modelEntryDirPath,
+                                           self._CHECKPOINT_LINK_NAME)
+
+    # Follow the checkpoint link; only the name of its target is used, since
+    # links of older entries hold the absolute path of the entry before it was
+    # migrated
+    try:
+      checkpointStoreDirName = os.path.basename(
+        os.readlink(currentStoreSymlinkPath))
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        raise
+      raise ModelNotFound("Checkpoint not found for model=%s; expected "
+                          "link=%s" % (modelID, currentStoreSymlinkPath,))
 
-    # Follow the chekpoint link
-    checkpointStoreDirPath = os.path.realpath(currentStoreSymlinkPath)
+    checkpointStoreDirPath = os.path.join(modelEntryDirPath,
+                                          checkpointStoreDirName)
 
     if not os.path.exists(checkpointStoreDirPath):
       raise ModelNotFound("Checkpoint not found for model=%s; expected "
                           "directory=%s" % (modelID, checkpointStoreDirPath,))
 
-    assert checkpointStoreDirPath != currentStoreSymlinkPath, (
-      checkpointStoreDirPath)
-
     return checkpointStoreDirPath
 
 
+  def _getCurrentCheckpointRealPath(self, modelID):
+    """ Get the path of the model's existing checkpoint store directory
+
+    raises:
+      ModelNotFound if the model checkpoint hasn't been saved yet or if this
+        model's entry doesn't exist in the checkpoint archive
+    """
+    return self._callWithModelEntry(
+      modelID,
+      lambda modelEntryDirPath: self._getCheckpointStoreDirPath(
+        modelID, modelEntryDirPath))
+
+
+  def _makeShardDirs(self, modelEntryDirPath):
+    """ Create the missing shard directories of a new model entry """
+    shardPath = self._storageRoot
+    for shardName in os.path.relpath(os.path.dirname(modelEntryDirPath),
+                                     self._storageRoot).split(os.sep):
+      if shardName == os.curdir:
+        # Flat layout
+        break
+
+      parentPath = shardPath
+      shardPath = os.path.join(shardPath, shardName)
+      try:
+        os.mkdir(shardPath)
+      except OSError as e:
+        if e.errno != errno.EEXIST:
+          raise
+      else:
+        self._fsyncDirectoryOnly(parentPath)
+
+
   @classmethod
   def _fsyncReliably(cls, fd):
     """ perform fsync operation on the given file descriptor, retrying on EINTR
@@ -270,6 +780,113 @@ class ModelCheckpointMgr(object):
     self._fsyncDirectoryOnly(rootPath)
 
 
+  def _retire(self, modelID, path):
+    """ Atomically move a checkpoint store or model entry to the retired
+    directory, from which it's deleted in the background
+
+    param modelID: model ID of the entry that the tree belongs to
+    param path: path of the directory tree
+    """
+    os.rename(path, os.path.join(self._retiredDir,
+                                 "%s-%s" % (modelID, uuid.uuid4().hex)))
+
+
+  def _retireStaleCheckpointStores(self, modelID, modelEntryDirPath,
+                                   currentCheckpointStoreDirName):
+    """ Retire the checkpoint stores of the model entry other than the current
+    one, and their input logs: the one that was replaced by save(), and any
+    that were left behind by a crash of save() or that were superseded in the
+    RAM tier before they were persisted. The retired stores are deleted in the
+    background.
+
+    NOTE: a retired store is moved back into the entry if the system crashes
+    before the rename is persisted; it's then retired by the next save().
+
+    :returns: number of checkpoint stores retired
+    """
+    currentNames = (
+      currentCheckpointStoreDirName,
+      currentCheckpointStoreDirName + self._CHECKPOINT_LOG_FILE_NAME_SUFFIX)
+
+    numRetired = 0
+    for name in os.listdir(modelEntryDirPath):
+      if (name.startswith(self._CHECKPOINT_STORE_DIR_NAME_BASE) and
+          name not in currentNames):
+        self._retire(modelID, os.path.join(modelEntryDirPath, name))
+        numRetired += 1
+
+    if numRetired:
+      _RetiredTreeReaper.notify(self._retiredDir)
+
+    return numRetired
+
+
+  def _cloneTree(self, srcDirPath, destDirPath, excludeNames=()):
+    """ Create a copy of a directory tree that shares the files of the source
+    tree if the filesystem supports it; symlinks are copied as symlinks
+
+    :param srcDirPath: path of the source directory
+    :param destDirPath: path of the destination directory, which must not
+      exist
+    :param excludeNames: names of top-level entries of the source directory
+      that are not copied
+    """
+    os.mkdir(destDirPath)
+
+    for name in os.listdir(srcDirPath):
+      if name in excludeNames:
+        continue
+
+      srcPath = os.path.join(srcDirPath, name)
+      destPath = os.path.join(destDirPath, name)
+      if os.path.islink(srcPath):
+        os.symlink(os.readlink(srcPath), destPath)
+      elif os.path.isdir(srcPath):
+        self._cloneTree(srcPath, destPath)
+      else:
+        self._cloneFile(srcPath, destPath)
+
+    shutil.copystat(srcDirPath, destDirPath)
+
+
+  def _cloneFile(self, srcPath, destPath):
+    """ Create destPath as a hard link to srcPath; if the filesystem can't hard
+    link files, as a reflink of srcPath; if it can't reflink files either, as a
+    copy of srcPath
+    """
+    if self._canHardLink:
+      try:
+        os.link(srcPath, destPath)
+        return
+      except OSError as e:
+        if e.errno not in self._FILE_SHARING_UNSUPPORTED_ERRNOS:
+          raise
+
+        self._logger.info("Hard links unsupported in %s (%r); trying reflinks",
+                          self._storageRoot, e)
+        self._canHardLink = False
+
+    if self._canReflink:
+      try:
+        with open(srcPath, "rb") as srcFileObj, \
+            open(destPath, "wb") as destFileObj:
+          fcntl.ioctl(destFileObj.fileno(), self._FICLONE_IOCTL,
+                      srcFileObj.fileno())
+        shutil.copystat(srcPath, destPath)
+        return
+      except EnvironmentError as e:
+        if e.errno not in self._FILE_SHARING_UNSUPPORTED_ERRNOS:
+          raise
+
+        self._logger.info("Reflinks unsupported in %s (%r); copying files",
+                          self._storageRoot, e)
+        self._canReflink = False
+        if os.path.exists(destPath):
+          os.unlink(destPath)
+
+    shutil.copy2(srcPath, destPath)
+
+
   def define(self, modelID, definition):
     """ Define a new model in model checkpoint archive.
 
@@ -284,6 +901,9 @@ class ModelCheckpointMgr(object):
     """
     startTime = time.time()
 
+    # Place the new entry per the current layout
+    self._loadLayout()
+
     modelEntryDirPath = self._getModelDir(modelID, mustExist=False)
     if os.path.exists(modelEntryDirPath):
       raise ModelAlreadyExists(
@@ -314,11 +934,13 @@ class ModelCheckpointMgr(object):
       # Get temp model entry tree in consistent state
       self._fsyncDirectoryTreeRecursively(tempModelEntryDirPath)
 
+      self._makeShardDirs(modelEntryDirPath)
+
       # Atomically rename the temp model entry dir as the actual model entry dir
       os.rename(tempModelEntryDirPath, modelEntryDirPath)
 
-      # Get checkpoint storage root directory into consistent state
-      self._fsyncDirectoryOnly(self._storageRoot)
+      # Get the directory of the model entry into consistent state
+      self._fsyncDirectoryOnly(os.path.dirname(modelEntryDirPath))
     finally:
       # Clean up
       shutil.rmtree(tempRoot)
@@ -341,11 +963,13 @@ class ModelCheckpointMgr(object):
     raises:
       ModelNotFound if model's entry doesn't exit in the checkpoint archive
     """
-    modelEntryDirPath = self._getModelDir(modelID, mustExist=True)
-    definitionFilePath = os.path.join(modelEntryDirPath,
-                                      self._MODEL_DEFINITION_FILE_NAME)
-    with open(definitionFilePath) as fileObj:
-      return json.load(fileObj)
+    def loadDefinition(modelEntryDirPath):
+      definitionFilePath = os.path.join(modelEntryDirPath,
+                                        self._MODEL_DEFINITION_FILE_NAME)
+      with open(definitionFilePath) as fileObj:
+        return json.load(fileObj)
+
+    return self._callWithModelEntry(modelID, loadDefinition)
 
 
   def save(self, modelID, model, attributes):
@@ -365,8 +989,64 @@ class ModelCheckpointMgr(object):
     """
     startTime = time.time()
 
-    modelEntryDirPath = self._getModelDir(modelID, mustExist=True)
+    # Fail before saving the model if the model entry doesn't exist
+    self._getModelDir(modelID, mustExist=True)
+
+    if self._ramRoot is not None and not self._isRamTierFlushBehind():
+      newCheckpointStoreDirPath = self._saveToRamTier(modelID, model,
+                                                      attributes)
+    else:
+      newCheckpointStoreDirPath = self._saveToArchive(
+        modelID,
+        lambda checkpointStoreDirPath: self._writeCheckpointStore(
+          checkpointStoreDirPath, model, attributes),
+        "%s%f" % (self._CHECKPOINT_STORE_DIR_NAME_BASE, time.time()))
+
+      if self._ramRoot is not None:
+        # The RAM tier's checkpoint, if any, is outdated now
+        self._removeRamTierEntry(modelID)
+
+    self._logger.info(
+      "{TAG:MCKPT.SAVE} Saved model=%s: duration=%ss; directory=%s",
+      modelID, time.time() - startTime, newCheckpointStoreDirPath)
+
+
+  def _writeCheckpointStore(self, checkpointStoreDirPath, model, attributes):
+    """ Create a checkpoint store directory with the checkpoint attributes and
+    the saved model
+    """
+    makeDirectoryFromAbsolutePath(checkpointStoreDirPath)
+
+    # Save the checkpoint attributes
+    attributesFilePath = os.path.join(
+      checkpointStoreDirPath,
+      self._CHECKPOINT_ATTRIBUTES_FILE_NAME)
+
+    with open(attributesFilePath, "wb") as fileObj:
+      json.dump(attributes, fileObj)
 
+    # Save the model
+    model.save(
+      saveModelDir=os.path.join(
+        checkpointStoreDirPath,
+        self._CHECKPOINT_INSTANCE_DIR_NAME))
+
+
+  def _saveToArchive(self, modelID, writeCheckpointStore,
+                     newCheckpointStoreDirName):
+    """ Install a new checkpoint store in the model's entry in the archive and
+    make it the current one
+
+    :param modelID: unique model ID hex string
+    :param writeCheckpointStore: function that creates the checkpoint store
+      directory at the path that's passed to it
+    :param newCheckpointStoreDirName: name of the new checkpoint store
+      directory
+
+    :returns: path of the new checkpoint store directory
+    :raises: ModelNotFound if model's entry doesn't exit in the checkpoint
+      archive
+    """
     # Create the model checkpoint store in a temp directory first, then rename
     # it to its location in the model entry for integrity
 
@@ -375,73 +1055,110 @@ class ModelCheckpointMgr(object):
       tempCheckpointStoreDirPath = os.path.join(
         tempRoot,
         self._CHECKPOINT_STORE_DIR_NAME_BASE)
-      makeDirectoryFromAbsolutePath(tempCheckpointStoreDirPath)
-
-      # Save the checkpoint attributes
-      attributesFilePath = os.path.join(
-        tempCheckpointStoreDirPath,
-        self._CHECKPOINT_ATTRIBUTES_FILE_NAME)
-
-      with open(attributesFilePath, "wb") as fileObj:
-        json.dump(attributes, fileObj)
-
-      # Save the model
-      model.save(
-        saveModelDir=os.path.join(
-          tempCheckpointStoreDirPath,
-          self._CHECKPOINT_INSTANCE_DIR_NAME))
+      writeCheckpointStore(tempCheckpointStoreDirPath)
 
       # Get temp checkpoint store tree in consistent state
       self._fsyncDirectoryTreeRecursively(tempCheckpointStoreDirPath)
 
-      # Atomically rename the temp checkpoint store dir into model entry dir
-      newCheckpointStoreDirPath = os.path.join(
-        modelEntryDirPath,
-        "%s%f" % (self._CHECKPOINT_STORE_DIR_NAME_BASE, time.time()))
+      # Prepare the new current checkpoint link; it's relative, so that it
+      # remains valid when the model entry is moved
+      tempCurrentStoreSymlinkPath = os.path.join(
+        tempRoot,
+        self._CHECKPOINT_LINK_NAME)
+      os.symlink(newCheckpointStoreDirName, tempCurrentStoreSymlinkPath)
+
+      def installCheckpointStore(modelEntryDirPath):
+        """ Move the new checkpoint store into the model entry and make it the
+        current one; may be called again after the entry was moved by a layout
+        migration
+        """
+        newCheckpointStoreDirPath = os.path.join(modelEntryDirPath,
+                                                 newCheckpointStoreDirName)
+
+        # Atomically rename the temp checkpoint store dir into model entry dir,
+        # unless it was moved there before the entry was moved
+        if os.path.exists(tempCheckpointStoreDirPath):
+          assert not os.path.exists(newCheckpointStoreDirPath), (
+            newCheckpointStoreDirPath)
+
+          os.rename(tempCheckpointStoreDirPath, newCheckpointStoreDirPath)
+
+        # Atomically point currentStoreSymlinkPath to
+        #  newCheckpointStoreDirPath
+        if os.path.lexists(tempCurrentStoreSymlinkPath):
+          os.rename(tempCurrentStoreSymlinkPath,
+                    os.path.join(modelEntryDirPath, self._CHECKPOINT_LINK_NAME))
+
+        # Sync the model entry directory to ensure consistency
+        # NOTE: we do this before retiring the old checkpoint store to protect
+        # current checkpoint integrity in the event of failure while retiring
+        # the old one.
+        self._fsyncDirectoryOnly(modelEntryDirPath)
+
+        # Lastly, hand the old checkpoint store dir over to the background
+        # reaper
+        self._retireStaleCheckpointStores(modelID, modelEntryDirPath,
+                                          newCheckpointStoreDirName)
+
+        return newCheckpointStoreDirPath
+
+      newCheckpointStoreDirPath = self._callWithModelEntry(
+        modelID, installCheckpointStore)
+    finally:
+      # Clean up
+      shutil.rmtree(tempRoot)
 
-      assert not os.path.exists(newCheckpointStoreDirPath), (
-        newCheckpointStoreDirPath)
+    return newCheckpointStoreDirPath
 
-      os.rename(tempCheckpointStoreDirPath, newCheckpointStoreDirPath)
 
-      # Prepare to switch the current checkpoint link
-      currentStoreSymlinkPath = os.path.join(
-        modelEntryDirPath,
-        self._CHECKPOINT_LINK_NAME)
+  def _saveToRamTier(self, modelID, model, attributes):
+    """ Save the checkpoint to the model's entry in the RAM tier without fsync
+    and mark it dirty, so that RamTierFlusher persists it to the archive
 
-      # But first, capture the real path of the old checkpoint store, so we can
-      # delete it later
-      if os.path.exists(currentStoreSymlinkPath):
-        oldCheckpointStoreDirPath = os.path.realpath(currentStoreSymlinkPath)
-        assert oldCheckpointStoreDirPath != currentStoreSymlinkPath, (
-          oldCheckpointStoreDirPath)
-      else:
-        oldCheckpointStoreDirPath = None
+    :returns: path of the new checkpoint store directory
+    """
+    tempRoot = tempfile.mkdtemp(prefix=modelID, dir=self._ramScratchDir)
+    try:
+      tempCheckpointStoreDirPath = os.path.join(
+        tempRoot,
+        self._CHECKPOINT_STORE_DIR_NAME_BASE)
+      self._writeCheckpointStore(tempCheckpointStoreDirPath, model, attributes)
+
+      newCheckpointStoreDirName = "%s%f" % (
+        self._CHECKPOINT_STORE_DIR_NAME_BASE, time.time())
 
-      # Atomically point currentStoreSymlinkPath to
-      #  newCheckpointStoreDirPath
       tempCurrentStoreSymlinkPath = os.path.join(
         tempRoot,
         self._CHECKPOINT_LINK_NAME)
-      os.symlink(newCheckpointStoreDirPath, tempCurrentStoreSymlinkPath)
-      os.rename(tempCurrentStoreSymlinkPath, currentStoreSymlinkPath)
-
-      # Sync the model entry directory to ensure consistency
-      # NOTE: we do this before deleting the old checkpoint store to protect
-      # current checkpoint integrity in the event of failure while deleting the
-      # old one.
-      self._fsyncDirectoryOnly(modelEntryDirPath)
-
-      # Lastly, remove the old checkpoint store dir
-      if oldCheckpointStoreDirPath is not None:
-        shutil.rmtree(oldCheckpointStoreDirPath)
+      os.symlink(newCheckpointStoreDirName, tempCurrentStoreSymlinkPath)
+
+      ramEntryDirPath = os.path.join(self._ramRoot, modelID)
+      newCheckpointStoreDirPath = os.path.join(ramEntryDirPath,
+                                               newCheckpointStoreDirName)
+
+      with self._lockRamTierEntry(modelID, exclusive=True):
+        # Mark the model dirty first, so that a crash can't leave an
+        # unpersisted checkpoint unmarked
+        self._markRamTierEntryDirty(modelID)
+
+        if not os.path.exists(ramEntryDirPath):
+          os.mkdir(ramEntryDirPath)
+
+        os.rename(tempCheckpointStoreDirPath, newCheckpointStoreDirPath)
+        os.rename(tempCurrentStoreSymlinkPath,
+                  os.path.join(ramEntryDirPath, self._CHECKPOINT_LINK_NAME))
+
+        # The old checkpoint store is either persisted or superseded; deleting
+        # from RAM is cheap
+        for name in os.listdir(ramEntryDirPath):
+          if (name.startswith(self._CHECKPOINT_STORE_DIR_NAME_BASE) and
+              name != newCheckpointStoreDirName):
+            shutil.rmtree(os.path.join(ramEntryDirPath, name))
     finally:
       # Clean up
       shutil.rmtree(tempRoot)
 
-    self._logger.info(
-      "{TAG:MCKPT.SAVE} Saved model=%s: duration=%ss; directory=%s",
-      modelID, time.time() - startTime, newCheckpointStoreDirPath)
+    return newCheckpointStoreDirPath
 
 
   def load(self, modelID):
@@ -457,12 +1174,15 @@ class ModelCheckpointMgr(object):
     """
     startTime = time.time()
 
-    checkpointStoreDirPath = self._getCurrentCheckpointRealPath(modelID)
+    def loadModel(checkpointStoreDirPath):
+      modelInstanceDirPath = os.path.join(checkpointStoreDirPath,
+                                          self._CHECKPOINT_INSTANCE_DIR_NAME)
 
-    modelInstanceDirPath = os.path.join(checkpointStoreDirPath,
-                                        self._CHECKPOINT_INSTANCE_DIR_NAME)
+      return (checkpointStoreDirPath,
+              ModelFactory.loadFromCheckpoint(modelInstanceDirPath))
 
-    model = ModelFactory.loadFromCheckpoint(modelInstanceDirPath)
+    checkpointStoreDirPath, model = self._callWithCurrentCheckpointStore(
+      modelID, loadModel)
 
     self._logger.info(
       "{TAG:MCKPT.LOAD} Loaded model=%s: duration=%ss; directory=%s",
@@ -483,10 +1203,42 @@ class ModelCheckpointMgr(object):
     :raises: ModelNotFound if the model checkpoint hasn't been saved yet or if
       this model's entry doesn't exist in the checkpoint archive
     """
-    checkpointDirPath = self._getCurrentCheckpointRealPath(modelID)
+    if self._ramRoot is not None:
+      with self._lockRamTierEntry(modelID, exclusive=True):
+        ramCheckpointStoreDirPath = self._getRamTierCheckpointStoreDirPath(
+          modelID)
+        if ramCheckpointStoreDirPath is not None:
+          (tempFd, tempPath) = tempfile.mkstemp(
+            suffix=self._CHECKPOINT_ATTRIBUTES_FILE_NAME,
+            prefix=modelID,
+            dir=self._ramScratchDir,
+            text=False)
+
+          try:
+            with os.fdopen(tempFd, "wb") as fileObj:
+              json.dump(attributes, fileObj)
+
+            self._markRamTierEntryDirty(modelID)
+            os.rename(tempPath,
+                      os.path.join(ramCheckpointStoreDirPath,
+                                   self._CHECKPOINT_ATTRIBUTES_FILE_NAME))
+          finally:
+            if os.path.exists(tempPath):
+              os.unlink(tempPath)
+
+          return
 
-    attributesFilePath = os.path.join(checkpointDirPath,
-                                      self._CHECKPOINT_ATTRIBUTES_FILE_NAME)
+    self._updateArchiveCheckpointAttributes(modelID, attributes)
+
+
+  def _updateArchiveCheckpointAttributes(self, modelID, attributes):
+    """ Update the attributes of the model's current checkpoint in the archive
+
+    :raises: ModelNotFound if the model checkpoint hasn't been saved yet or if
+      this model's entry doesn't exist in the checkpoint archive
+    """
+    # Fail before creating the new attributes file if there is no checkpoint
+    self._getCurrentCheckpointRealPath(modelID)
 
     # Create the new attributes file as a temp in our scratch directory
     (tempFd, tempPath) = tempfile.mkstemp(
@@ -501,11 +1253,24 @@ class ModelCheckpointMgr(object):
       fileObj.flush()
       self._fsyncReliably(tempFd)
 
-    # Automically move the temp file into the current checkpoint
-    os.rename(tempPath, attributesFilePath)
+    def installAttributes(modelEntryDirPath):
+      checkpointDirPath = self._getCheckpointStoreDirPath(modelID,
+                                                          modelEntryDirPath)
+
+      attributesFilePath = os.path.join(checkpointDirPath,
+                                        self._CHECKPOINT_ATTRIBUTES_FILE_NAME)
+
+      # Automically move the temp file into the current checkpoint
+      os.rename(tempPath, attributesFilePath)
 
-    # Get checkpoint directory into consistent state
-    self._fsyncDirectoryOnly(checkpointDirPath)
+      # Get checkpoint directory into consistent state
+      self._fsyncDirectoryOnly(checkpointDirPath)
+
+    try:
+      self._callWithModelEntry(modelID, installAttributes)
+    finally:
+      if os.path.exists(tempPath):
+        os.unlink(tempPath)
 
 
   def loadCheckpointAttributes(self, modelID):
@@ -522,12 +1287,489 @@ class ModelCheckpointMgr(object):
     :raises: ModelNotFound if the model checkpoint hasn't been saved yet or if
       this model's entry doesn't exist in the checkpoint archive
     """
-    attributesFilePath = os.path.join(
-      self._getCurrentCheckpointRealPath(modelID),
-      self._CHECKPOINT_ATTRIBUTES_FILE_NAME)
+    def loadAttributes(checkpointStoreDirPath):
+      attributesFilePath = os.path.join(checkpointStoreDirPath,
+                                        self._CHECKPOINT_ATTRIBUTES_FILE_NAME)
+
+      with open(attributesFilePath) as fileObj:
+        return json.load(fileObj)
+
+    return self._callWithCurrentCheckpointStore(modelID, loadAttributes)
+
+
+  def appendCheckpointLog(self, modelID, record):
+    """ Append a record to the input log of the model's current checkpoint
+    and fsync it; the log starts out empty with each checkpoint saved by
+    save(). The records of a model must be appended by one thread at a time.
+
+    :param modelID: unique model ID hex string
+    :param record: the record; a string
+
+    :raises: ModelNotFound if the model checkpoint hasn't been saved yet or if
+      this model's entry doesn't exist in the checkpoint archive
+    """
+    checkpointStoreDirName = self._callWithCurrentCheckpointStore(
+      modelID, os.path.basename)
+
+    def openLog(modelEntryDirPath):
+      logFilePath = os.path.join(
+        modelEntryDirPath,
+        checkpointStoreDirName + self._CHECKPOINT_LOG_FILE_NAME_SUFFIX)
+
+      isNew = not os.path.exists(logFilePath)
+      fd = os.open(logFilePath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+      try:
+        if isNew:
+          self._fsyncDirectoryOnly(modelEntryDirPath)
+      except:
+        os.close(fd)
+        raise
+
+      return logFilePath, fd
+
+    logFilePath, fd = self._callWithModelEntry(modelID, openLog)
+    try:
+      logSize = os.fstat(fd).st_size
+      if self._checkpointLogSizes.get(logFilePath) != logSize:
+        with open(logFilePath, "rb") as fileObj:
+          validLogSize = self._readCheckpointLogRecords(fileObj)[1]
+
+        if validLogSize != logSize:
+          # Records appended after a torn one would be unreachable
+          self._logger.warn("Discarding torn record at the end of the input "
+                            "log=%s: %d of %d bytes", logFilePath,
+                            logSize - validLogSize, logSize)
+          os.ftruncate(fd, validLogSize)
+          logSize = validLogSize
+
+      data = self._CHECKPOINT_LOG_RECORD_HEADER.pack(
+        len(record), zlib.crc32(record) & 0xffffffff) + record
+      numWritten = 0
+      while numWritten < len(data):
+        numWritten += os.write(fd, data[numWritten:])
+
+      self._fsyncReliably(fd)
+    finally:
+      os.close(fd)
+
+    self._checkpointLogSizes[logFilePath] = logSize + len(data)
+
+
+  def loadCheckpointLog(self, modelID):
+    """ Retrieve the records of the input log of the model's current
+    checkpoint
+
+    :param modelID: unique model ID
+
+    :returns: the records that were appended by
+      ModelCheckpointMgr.appendCheckpointLog() since the checkpoint was saved,
+      in order; a sequence of strings
+
+    :raises: ModelNotFound if the model checkpoint hasn't been saved yet or if
+      this model's entry doesn't exist in the checkpoint archive
+    """
+    checkpointStoreDirName = self._callWithCurrentCheckpointStore(
+      modelID, os.path.basename)
+
+    def loadRecords(modelEntryDirPath):
+      logFilePath = os.path.join(
+        modelEntryDirPath,
+        checkpointStoreDirName + self._CHECKPOINT_LOG_FILE_NAME_SUFFIX)
+      try:
+        fileObj = open(logFilePath, "rb")
+      except IOError as e:
+        if e.errno != errno.ENOENT:
+          raise
+
+        if not os.path.isdir(modelEntryDirPath):
+          # Let _callWithModelEntry look for the entry
+          raise ModelNotFound("Model entry of model=%s not found at %s" % (
+            modelID, modelEntryDirPath,))
+
+        # Nothing was appended yet
+        return logFilePath, [], 0
+
+      with fileObj:
+        records, validLogSize = self._readCheckpointLogRecords(fileObj)
+
+      return logFilePath, records, validLogSize
+
+    logFilePath, records, validLogSize = self._callWithModelEntry(modelID,
+                                                                  loadRecords)
+
+    self._checkpointLogSizes[logFilePath] = validLogSize
+
+    return records
+
+
+  @classmethod
+  def _readCheckpointLogRecords(cls, fileObj):
+    """ Read the records of an input log up to the end or to the first torn
+    record
+
+    param fileObj: the input log file opened for reading in binary mode
+    returns: a two-tuple of the records and their total byte length, headers
+      included
+    """
+    records = []
+    validLogSize = 0
+    headerSize = cls._CHECKPOINT_LOG_RECORD_HEADER.size
+    while True:
+      header = fileObj.read(headerSize)
+      if len(header) < headerSize:
+        break
+
+      recordSize, checksum = cls._CHECKPOINT_LOG_RECORD_HEADER.unpack(header)
+      record = fileObj.read(recordSize)
+      if (len(record) < recordSize or
+          zlib.crc32(record) & 0xffffffff != checksum):
+        break
+
+      records.append(record)
+      validLogSize += headerSize + recordSize
+
+    return records, validLogSize
+
+
+  def _callWithCurrentCheckpointStore(self, modelID, func):
+    """ Call func with the path of the model's current checkpoint store
+    directory: in the RAM tier if it has a checkpoint that's at least as new as
+    the archive's, in the archive otherwise
+
+    :returns: the return value of func
+    :raises: ModelNotFound if the model checkpoint hasn't been saved yet or if
+      this model's entry doesn't exist in the checkpoint archive
+    """
+    if self._ramRoot is not None:
+      with self._lockRamTierEntry(modelID, exclusive=False):
+        ramCheckpointStoreDirPath = self._getRamTierCheckpointStoreDirPath(
+          modelID)
+        if ramCheckpointStoreDirPath is not None:
+          return func(ramCheckpointStoreDirPath)
+
+    return self._callWithModelEntry(
+      modelID,
+      lambda modelEntryDirPath: func(self._getCheckpointStoreDirPath(
+        modelID, modelEntryDirPath)))
+
+
+  def _lockRamTierEntry(self, modelID, exclusive):
+    """ Lock the model's entry in the RAM tier against other threads and
+    processes: exclusively for changing it, shared for reading it
+    """
+    return self._lockRamTier(modelID, exclusive)
+
+
+  @contextlib.contextmanager
+  def _lockRamTier(self, lockName, exclusive):
+    """ Context manager that holds the flock() of the given lock file of the
+    RAM tier
+    """
+    fd = os.open(os.path.join(self._ramLockDir, lockName),
+                 os.O_RDWR | os.O_CREAT, 0644)
+    try:
+      fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+      yield
+    finally:
+      # Closing the file releases the lock
+      os.close(fd)
+
+
+  def _markRamTierEntryDirty(self, modelID):
+    """ Create the model's dirty marker unless it exists, which keeps the time
+    of the oldest unpersisted save. The caller holds the exclusive lock
+    """
+    try:
+      os.close(os.open(os.path.join(self._ramDirtyDir, modelID),
+                       os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0644))
+    except OSError as e:
+      if e.errno != errno.EEXIST:
+        raise
+
+
+  def _isRamTierFlushBehind(self):
+    """ Whether a checkpoint in the RAM tier is waiting for persistence for
+    longer than the durability window, in which case new checkpoints are saved
+    to the archive directly
+    """
+    now = time.time()
+    for modelID in os.listdir(self._ramDirtyDir):
+      try:
+        dirtySinceTime = os.stat(os.path.join(self._ramDirtyDir,
+                                              modelID)).st_mtime
+      except OSError as e:
+        if e.errno == errno.ENOENT:
+          # Persisted in the meantime
+          continue
+        raise
+
+      if now - dirtySinceTime > self._ramMaxFlushLagSec:
+        self._logger.warning(
+          "Checkpoint of model=%s in the RAM tier is unpersisted for %ss; "
+          "saving to the archive directly", modelID, now - dirtySinceTime)
+        return True
+
+    return False
+
+
+  def _getCheckpointStoreTime(self, checkpointStoreDirName):
+    return float(
+      checkpointStoreDirName[len(self._CHECKPOINT_STORE_DIR_NAME_BASE):])
+
+
+  def _getRamTierCheckpointStoreDirName(self, modelID):
+    """
+    :returns: name of the current checkpoint store directory of the model's
+      entry in the RAM tier; None if it has none
+    """
+    try:
+      return os.readlink(os.path.join(self._ramRoot, modelID,
+                                      self._CHECKPOINT_LINK_NAME))
+    except OSError as e:
+      if e.errno == errno.ENOENT:
+        return None
+      raise
+
+
+  def _getArchiveCheckpointStoreDirName(self, modelID):
+    """
+    :returns: name of the current checkpoint store directory of the model's
+      entry in the archive; None if the model has no checkpoint
+
+    :raises: ModelNotFound if the model's entry doesn't exist in the archive
+    """
+    try:
+      return os.path.basename(self._getCurrentCheckpointRealPath(modelID))
+    except ModelNotFound:
+      # Raises ModelNotFound if the entry doesn't exist
+      self._getModelDir(modelID, mustExist=True)
+      return None
+
+
+  def _getRamTierCheckpointStoreDirPath(self, modelID):
+    """ The caller holds the lock of the model's entry in the RAM tier
+
+    :returns: path of the model's current checkpoint store directory in the
+      RAM tier if it's at least as new as the archive's; None otherwise
+
+    :raises: ModelNotFound if the model's entry doesn't exist in the archive
+    """
+    ramCheckpointStoreDirName = self._getRamTierCheckpointStoreDirName(modelID)
+    if ramCheckpointStoreDirName is None:
+      return None
+
+    archiveCheckpointStoreDirName = self._getArchiveCheckpointStoreDirName(
+      modelID)
+    if (archiveCheckpointStoreDirName is not None and
+        self._getCheckpointStoreTime(ramCheckpointStoreDirName) <
+        self._getCheckpointStoreTime(archiveCheckpointStoreDirName)):
+      return None
+
+    return os.path.join(self._ramRoot, modelID, ramCheckpointStoreDirName)
+
 
-    with open(attributesFilePath) as fileObj:
-      return json.load(fileObj)
+  def _removeRamTierEntry(self, modelID):
+    """ Delete the model's entry and dirty marker from the RAM tier, if any """
+    with self._lockRamTierEntry(modelID, exclusive=True):
+      self._removeRamTierEntryLocked(modelID)
+
+
+  def _removeRamTierEntryLocked(self, modelID):
+    """ Delete the model's entry and dirty marker from the RAM tier, if any;
+    the caller holds the exclusive lock
+    """
+    ramEntryDirPath = os.path.join(self._ramRoot, modelID)
+    if os.path.exists(ramEntryDirPath):
+      shutil.rmtree(ramEntryDirPath)
+
+    try:
+      os.unlink(os.path.join(self._ramDirtyDir, modelID))
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        raise
+
+
+  def flushRamTier(self):
+    """ Persist the dirty checkpoints of the RAM tier to the archive, oldest
+    first, then evict the least recently saved clean entries in excess of
+    ram_max_models. Called periodically by RamTierFlusher; the first call after
+    a restart reconciles the tiers, since dirty markers outlive processes.
+
+    :returns: number of checkpoints persisted
+    """
+    if self._ramRoot is None:
+      return 0
+
+    dirtyModels = []
+    for modelID in os.listdir(self._ramDirtyDir):
+      try:
+        dirtyModels.append(
+          (os.stat(os.path.join(self._ramDirtyDir, modelID)).st_mtime,
+           modelID))
+      except OSError as e:
+        if e.errno != errno.ENOENT:
+          raise
+
+    numFlushed = 0
+    for _dirtySinceTime, modelID in sorted(dirtyModels):
+      if self._flushRamTierEntry(modelID):
+        numFlushed += 1
+
+    self._evictRamTierEntries()
+    self._removeStaleRamTierScratch()
+
+    return numFlushed
+
+
+  def _getRamTierFlushAction(self, modelID):
+    """ Determine how to persist the model's entry in the RAM tier; the caller
+    holds its lock
+
+    :returns: one of
+      None: the entry is clean
+      _RAM_TIER_PERSIST_CHECKPOINT: the checkpoint is newer than the archive's
+      _RAM_TIER_PERSIST_ATTRIBUTES: the checkpoint is the archive's current
+        one, and its attributes were updated
+      _RAM_TIER_DROP: the entry is obsolete, since the model was removed or
+        a newer checkpoint was saved to the archive directly, or it's left
+        incomplete by a crash
+    """
+    if not os.path.exists(os.path.join(self._ramDirtyDir, modelID)):
+      return None
+
+    try:
+      archiveCheckpointStoreDirName = self._getArchiveCheckpointStoreDirName(
+        modelID)
+    except ModelNotFound:
+      return self._RAM_TIER_DROP
+
+    ramCheckpointStoreDirName = self._getRamTierCheckpointStoreDirName(modelID)
+    if ramCheckpointStoreDirName is None:
+      return self._RAM_TIER_DROP
+
+    if (archiveCheckpointStoreDirName is None or
+        self._getCheckpointStoreTime(ramCheckpointStoreDirName) >
+        self._getCheckpointStoreTime(archiveCheckpointStoreDirName)):
+      return self._RAM_TIER_PERSIST_CHECKPOINT
+
+    if ramCheckpointStoreDirName == archiveCheckpointStoreDirName:
+      return self._RAM_TIER_PERSIST_ATTRIBUTES
+
+    return self._RAM_TIER_DROP
+
+
+  def _flushRamTierEntry(self, modelID):
+    """ Persist the model's checkpoint in the RAM tier to the archive if it's
+    dirty. Entries are persisted under the shared lock, so that loads aren't
+    blocked, and under the RAM tier's flush lock, which excludes other
+    flushers.
+
+    :returns: True if the checkpoint or its attributes were persisted
+    """
+    startTime = time.time()
+
+    with self._lockRamTier(self._RAM_TIER_FLUSH_LOCK_NAME, exclusive=True):
+      with self._lockRamTierEntry(modelID, exclusive=False):
+        action = self._getRamTierFlushAction(modelID)
+
+        if action in (self._RAM_TIER_PERSIST_CHECKPOINT,
+                      self._RAM_TIER_PERSIST_ATTRIBUTES):
+          ramCheckpointStoreDirName = self._getRamTierCheckpointStoreDirName(
+            modelID)
+          ramCheckpointStoreDirPath = os.path.join(self._ramRoot, modelID,
+                                                   ramCheckpointStoreDirName)
+
+          if action == self._RAM_TIER_PERSIST_CHECKPOINT:
+            self._saveToArchive(
+              modelID,
+              lambda checkpointStoreDirPath: shutil.copytree(
+                ramCheckpointStoreDirPath, checkpointStoreDirPath,
+                symlinks=True),
+              ramCheckpointStoreDirName)
+          else:
+            attributesFilePath = os.path.join(
+              ramCheckpointStoreDirPath,
+              self._CHECKPOINT_ATTRIBUTES_FILE_NAME)
+            with open(attributesFilePath) as fileObj:
+              attributes = json.load(fileObj)
+            self._updateArchiveCheckpointAttributes(modelID, attributes)
+
+          os.unlink(os.path.join(self._ramDirtyDir, modelID))
+
+          self._logger.info(
+            "{TAG:MCKPT.FLUSH} Persisted model=%s from the RAM tier: "
+            "duration=%ss; store=%s", modelID, time.time() - startTime,
+            ramCheckpointStoreDirName)
+
+          return True
+
+      if action == self._RAM_TIER_DROP:
+        with self._lockRamTierEntry(modelID, exclusive=True):
+          # Unless saved again while unlocked
+          if self._getRamTierFlushAction(modelID) == self._RAM_TIER_DROP:
+            self._logger.info("Dropping obsolete entry of model=%s from the "
+                              "RAM tier", modelID)
+            self._removeRamTierEntryLocked(modelID)
+
+    return False
+
+
+  def _evictRamTierEntries(self):
+    """ Delete the least recently saved clean entries from the RAM tier in
+    excess of ram_max_models
+
+    :returns: number of entries deleted
+    """
+    modelIDs = [name for name in os.listdir(self._ramRoot)
+                if not name.startswith(".")]
+    numExcess = len(modelIDs) - self._ramMaxModels
+    if numExcess <= 0:
+      return 0
+
+    dirtyModelIDs = set(os.listdir(self._ramDirtyDir))
+    candidates = []
+    for modelID in modelIDs:
+      if modelID in dirtyModelIDs:
+        continue
+
+      ramCheckpointStoreDirName = self._getRamTierCheckpointStoreDirName(
+        modelID)
+      candidates.append(
+        (self._getCheckpointStoreTime(ramCheckpointStoreDirName)
+         if ramCheckpointStoreDirName is not None else 0,
+         modelID))
+
+    numEvicted = 0
+    for _savedTime, modelID in sorted(candidates)[:numExcess]:
+      with self._lockRamTierEntry(modelID, exclusive=True):
+        if os.path.exists(os.path.join(self._ramDirtyDir, modelID)):
+          # Saved again in the meantime
+          continue
+
+        self._removeRamTierEntryLocked(modelID)
+        numEvicted += 1
+
+    return numEvicted
+
+
+  def _removeStaleRamTierScratch(self):
+    """ Delete the temporary directories and files that crashed processes left
+    in the scratch directory of the RAM tier
+    """
+    now = time.time()
+    for name in os.listdir(self._ramScratchDir):
+      path = os.path.join(self._ramScratchDir, name)
+      try:
+        if now - os.lstat(path).st_mtime < self._RAM_TIER_SCRATCH_MAX_AGE_SEC:
+          continue
+
+        if os.path.isdir(path):
+          shutil.rmtree(path)
+        else:
+          os.unlink(path)
+      except OSError as e:
+        if e.errno != errno.ENOENT:
+          raise
 
 
   def clone(self, modelID, destModelID):
@@ -542,7 +1784,10 @@ class ModelCheckpointMgr(object):
     """
     startTime = time.time()
 
-    srcModelEntryDirPath = self._getModelDir(modelID, mustExist=True)
+    # Place the new entry per the current layout
+    self._loadLayout()
+
+    self._getModelDir(modelID, mustExist=True)
 
     destModelEntryDirPath = self._getModelDir(destModelID, mustExist=False)
     if os.path.exists(destModelEntryDirPath):
@@ -550,36 +1795,70 @@ class ModelCheckpointMgr(object):
         "Model archive entry already exists for clone destModel=%s at "
         "path=%s" % (destModelID, destModelEntryDirPath,))
 
+    if self._ramRoot is not None:
+      # Clone the latest checkpoint
+      self._flushRamTierEntry(modelID)
+
     # Create the model entry tree in a temp directory first, then rename it
     # to its permanent location in the model archive for integrity
 
     tempRoot = tempfile.mkdtemp(prefix=destModelID, dir=self._scratchDir)
     try:
-      # Copy the source model entry to destination entry in temp tree
+      # Clone the source model entry to destination entry in temp tree
       tempModelEntryDirPath = os.path.join(tempRoot, destModelID)
-      shutil.copytree(srcModelEntryDirPath,
-                      tempModelEntryDirPath,
-                      symlinks=True)
 
-      # Fix up the checkpoint store link, if present
+      def cloneModelEntry(srcModelEntryDirPath):
+        if os.path.exists(tempModelEntryDirPath):
+          # Partial clone of an entry that was moved by a layout migration
+          shutil.rmtree(tempModelEntryDirPath)
+
+        # Only the current checkpoint store is cloned, not stale ones that are
+        # about to be retired; its input log is copied, since it's appended to
+        excludedNames = set(
+          name for name in os.listdir(srcModelEntryDirPath)
+          if name.startswith(self._CHECKPOINT_STORE_DIR_NAME_BASE))
+        try:
+          checkpointStoreDirName = os.path.basename(
+            self._getCheckpointStoreDirPath(modelID, srcModelEntryDirPath))
+        except ModelNotFound:
+          # No checkpoint yet
+          checkpointStoreDirName = None
+        else:
+          excludedNames.discard(checkpointStoreDirName)
+
+        self._cloneTree(srcModelEntryDirPath, tempModelEntryDirPath,
+                        excludeNames=excludedNames)
+
+        if checkpointStoreDirName is not None:
+          logFileName = (checkpointStoreDirName +
+                         self._CHECKPOINT_LOG_FILE_NAME_SUFFIX)
+          if os.path.exists(os.path.join(srcModelEntryDirPath, logFileName)):
+            shutil.copy2(os.path.join(srcModelEntryDirPath, logFileName),
+                         os.path.join(tempModelEntryDirPath, logFileName))
+
+      self._callWithModelEntry(modelID, cloneModelEntry)
+
+      # Fix up the checkpoint store link of older entries, if present, which
+      # holds the absolute path of the source store
       tempStoreSymlinkPath = os.path.join(tempModelEntryDirPath,
                                           self._CHECKPOINT_LINK_NAME)
-      if os.path.exists(tempStoreSymlinkPath):
-        srcCheckpointStoreDirPath = os.path.realpath(tempStoreSymlinkPath)
-        os.unlink(tempStoreSymlinkPath)
-        os.symlink(
-          os.path.join(destModelEntryDirPath,
-                       os.path.basename(srcCheckpointStoreDirPath)),
-          tempStoreSymlinkPath)
+      if os.path.lexists(tempStoreSymlinkPath):
+        srcCheckpointStoreDirPath = os.readlink(tempStoreSymlinkPath)
+        if os.path.isabs(srcCheckpointStoreDirPath):
+          os.unlink(tempStoreSymlinkPath)
+          os.symlink(os.path.basename(srcCheckpointStoreDirPath),
+                     tempStoreSymlinkPath)
 
       # Get temp model entry tree in consistent state
       self._fsyncDirectoryTreeRecursively(tempModelEntryDirPath)
 
+      self._makeShardDirs(destModelEntryDirPath)
+
       # Atomically relocate the temp model entry tree to the model archive
       os.rename(tempModelEntryDirPath, destModelEntryDirPath)
 
-      # Get checkpoint storage root directory into consistent state
-      self._fsyncDirectoryOnly(self._storageRoot)
+      # Get the directory of the model entry into consistent state
+      self._fsyncDirectoryOnly(os.path.dirname(destModelEntryDirPath))
     finally:
       # Clean up
       shutil.rmtree(tempRoot)
@@ -598,15 +1877,18 @@ class ModelCheckpointMgr(object):
     :raises: ModelNotFound if model's entry doesn't exit in the checkpoint
       archive
     """
-    tempRoot = tempfile.mkdtemp(prefix=modelID, dir=self._scratchDir)
-    try:
-      # Move model entry atomically to scratch dir
-      modelEntryDirPath = self._getModelDir(modelID, mustExist=True)
-      os.rename(modelEntryDirPath, os.path.join(tempRoot, "deleteMe"))
-      self._fsyncDirectoryOnly(self._storageRoot)
-    finally:
-      # Then, delete from scratch dir
-      shutil.rmtree(tempRoot)
+    if self._ramRoot is not None:
+      self._removeRamTierEntry(modelID)
+
+    def retireModelEntry(modelEntryDirPath):
+      # Move model entry atomically to the retired dir
+      self._retire(modelID, modelEntryDirPath)
+      self._fsyncDirectoryOnly(os.path.dirname(modelEntryDirPath))
+
+    self._callWithModelEntry(modelID, retireModelEntry)
+
+    # Then, delete it in the background
+    _RetiredTreeReaper.notify(self._retiredDir)
 
 
   @classmethod
@@ -623,12 +1905,44 @@ class ModelCheckpointMgr(object):
       _getLogger().info("removeAll: not a directory or doesn't exist: %s",
                         storageRoot)
 
+    ramRoot = cls._getRamTierConfig()[0]
+    if ramRoot is not None and os.path.isdir(ramRoot):
+      _getLogger().info("removeAll: Removing the RAM tier at dir=%s", ramRoot)
+      shutil.rmtree(ramRoot)
+
 
   def getModelIDs(self):
     """ Return a sequence of all model IDs found in storage
 
     :returns: sequence of model IDs
     """
+    self._loadLayout()
+
+    if self._migratingToVersion is not None:
+      # Entries that are migrated while listing are found in the new layout,
+      # which is listed last, and possibly also in the old one
+      return list(set(self._listFlatModelEntries()) |
+                  set(self._listHashedModelEntries()))
+    elif self._layoutVersion == self._HASHED_LAYOUT_VERSION:
+      return self._listHashedModelEntries()
+    else:
+      return self._listFlatModelEntries()
+
+
+  def _isTopLevelShardName(self, name):
+    if len(name) != self._HASHED_LAYOUT_SHARD_WIDTHS[0]:
+      return False
+
+    try:
+      int(name, 16)
+    except ValueError:
+      return False
+
+    return True
+
+
+  def _listFlatModelEntries(self):
+    """ List the model IDs of the entries of the flat layout """
     try:
       dirNames = os.listdir(self._storageRoot)
     except OSError as e:
@@ -636,4 +1950,166 @@ class ModelCheckpointMgr(object):
         return list()
       else:
         raise
-    return [x for x in dirNames if not x.startswith('.')]
+
+    if self._layoutVersion == self._FLAT_LAYOUT_VERSION and (
+        self._migratingToVersion is None):
+      return [x for x in dirNames if not x.startswith('.')]
+
+    return [x for x in dirNames
+            if not x.startswith('.') and not self._isTopLevelShardName(x)]
+
+
+  def _listHashedModelEntries(self):
+    """ List the model IDs of the entries of the hashed layout """
+    try:
+      dirNames = os.listdir(self._storageRoot)
+    except OSError as e:
+      if e.errno == errno.ENOENT:
+        return list()
+      else:
+        raise
+
+    modelIDs = []
+    for topLevelShardName in dirNames:
+      if not self._isTopLevelShardName(topLevelShardName):
+        continue
+
+      topLevelShardPath = os.path.join(self._storageRoot, topLevelShardName)
+      for shardName in os.listdir(topLevelShardPath):
+        modelIDs.extend(
+          x for x in os.listdir(os.path.join(topLevelShardPath, shardName))
+          if not x.startswith('.'))
+
+    return modelIDs
+
+
+  def migrateToHashedLayout(self):
+    """ Convert the archive from the flat layout to the hashed layout while it
+    is in use. Model entries are moved one at a time; until the migration is
+    complete, they are looked up in both layouts, and operations on an entry
+    that is moved while they're in progress are retried at its new location.
+    An interrupted migration is resumed by calling this method again.
+
+    define() and clone() re-read the layout, so new entries are placed in the
+    hashed layout once the migration has started. An entry that is defined by
+    a process that read the layout just before the migration started and
+    renamed into place just after it ended is moved by calling this method
+    again.
+
+    :returns: number of model entries that were moved
+    """
+    startTime = time.time()
+
+    self._loadLayout()
+    if (self._layoutVersion == self._HASHED_LAYOUT_VERSION and
+        not self._listFlatModelEntries()):
+      self._logger.info("Model checkpoint archive at %s already has the "
+                        "hashed layout", self._storageRoot)
+      return 0
+
+    if self._migratingToVersion is None:
+      self._saveLayout(self._FLAT_LAYOUT_VERSION,
+                       migratingToVersion=self._HASHED_LAYOUT_VERSION)
+
+    numMigrated = 0
+    while True:
+      modelIDs = self._listFlatModelEntries()
+      if not modelIDs:
+        break
+
+      shardPaths = set()
+      for modelID in modelIDs:
+        if self._migrateModelEntry(modelID, shardPaths):
+          numMigrated += 1
+          if numMigrated % self._MIGRATION_PROGRESS_INTERVAL == 0:
+            self._logger.info("Migrated %d model entries in %ss",
+                              numMigrated, time.time() - startTime)
+
+      # Get the directories of the moved entries into consistent state
+      for shardPath in shardPaths:
+        self._fsyncDirectoryOnly(shardPath)
+      self._fsyncDirectoryOnly(self._storageRoot)
+
+    self._saveLayout(self._HASHED_LAYOUT_VERSION)
+
+    self._logger.info(
+      "{TAG:MCKPT.MIGRATE} "
+      "Migrated %d model entries to the hashed layout: duration=%ss; "
+      "directory=%s",
+      numMigrated, time.time() - startTime, self._storageRoot)
+
+    return numMigrated
+
+
+  def _migrateModelEntry(self, modelID, shardPaths):
+    """ Move a model entry from the flat layout to the hashed layout
+
+    :param modelID: model ID of the entry
+    :param set shardPaths: the directory of the moved entry is added to it
+
+    :returns: True if the entry was moved; False if it was removed in the
+      meantime
+    """
+    flatModelEntryDirPath = self._getFlatModelDir(modelID)
+    hashedModelEntryDirPath = self._getHashedModelDir(modelID)
+
+    self._makeShardDirs(hashedModelEntryDirPath)
+
+    if os.path.exists(hashedModelEntryDirPath):
+      raise ModelAlreadyExists(
+        "Cannot migrate model=%s: entries exist at both path=%s and path=%s" %
+        (modelID, flatModelEntryDirPath, hashedModelEntryDirPath))
+
+    try:
+      os.rename(flatModelEntryDirPath, hashedModelEntryDirPath)
+    except OSError as e:
+      if e.errno == errno.ENOENT:
+        return False
+      raise
+
+    shardPaths.add(os.path.dirname(hashedModelEntryDirPath))
+
+    return True
+
+
+
+class RamTierFlusher(object):
+  """ Persists the checkpoints that ModelCheckpointMgr saves to its RAM tier
+  to the archive; runs in the model scheduler service when the RAM tier is
+  configured. Each pass persists the dirty checkpoints oldest first, so the
+  lag of a checkpoint is bounded by the poll interval plus the time to persist
+  the checkpoints that were saved before it.
+  """
+
+  # Max interval between passes over the RAM tier
+  _MAX_POLL_INTERVAL_SEC = 1.0
+
+
+  def __init__(self):
+    self._logger = _getLogger()
+    self._checkpointMgr = ModelCheckpointMgr()
+    self._pollIntervalSec = min(
+      self._MAX_POLL_INTERVAL_SEC,
+      self._checkpointMgr._ramMaxFlushLagSec / 4.0)  # pylint: disable=W0212
+    self._stopEvent = threading.Event()
+
+
+  def run(self):
+    """ Persist the RAM tier's checkpoints until requestStopTS() is called;
+    the first pass persists what was left unpersisted before a restart, and
+    the last one what was saved until the stop
+    """
+    self._logger.info("Persisting the checkpoints of the RAM tier")
+
+    while not self._stopEvent.isSet():
+      if not self._checkpointMgr.flushRamTier():
+        self._stopEvent.wait(self._pollIntervalSec)
+
+    numFlushed = self._checkpointMgr.flushRamTier()
+    self._logger.info("Stopped; persisted %d checkpoints in the last pass",
+                      numFlushed)
+
+
+  def requestStopTS(self):
+    """ [thread-safe] Request run() to return after a last pass """
+    self._stopEvent.set()
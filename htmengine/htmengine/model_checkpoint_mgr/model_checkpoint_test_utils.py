@@ -21,6 +21,7 @@
 
 """ Model Checkpoint utilities for tests """
 
+import errno
 import functools
 import logging
 import os
@@ -130,7 +131,14 @@ class ModelCheckpointStoragePatch(object):
   def stop(self):
     self._configPatch.stop()
 
-    shutil.rmtree(self._tempParentDir)
+    def onError(_func, _path, excInfo):
+      # The background reaper of ModelCheckpointMgr may still be deleting
+      # retired trees
+      if not (isinstance(excInfo[1], EnvironmentError) and
+              excInfo[1].errno == errno.ENOENT):
+        raise excInfo[0], excInfo[1], excInfo[2]
+
+    shutil.rmtree(self._tempParentDir, onerror=onError)
 
     self.active = False
     self._logger.info("%s: removed model checkpoint storage override %s",
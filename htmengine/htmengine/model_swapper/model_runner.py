@@ -34,6 +34,7 @@ import select
 import sys
 import time
 import traceback
+import uuid
 
 
 from nupic.data.fieldmeta import FieldMetaInfo
@@ -47,6 +48,7 @@ from htmengine.model_checkpoint_mgr import model_checkpoint_mgr
 from htmengine.model_checkpoint_mgr.model_checkpoint_mgr import (
     ModelCheckpointMgr)
 from htmengine.model_swapper import ModelSwapperConfig
+from htmengine.model_swapper.model_snapshot_handoff import ModelSnapshotHandoff
 from htmengine.model_swapper.model_swapper_interface import (
     ModelCommand, ModelCommandResult,
     ModelInferenceResult, ModelInputRow, ModelSwapperInterface)
@@ -541,6 +543,21 @@ class ModelRunner(object):
 
 class _ModelArchiver(object):
   """ Helper class for loading/creating and checkpointing model
+
+  A full checkpoint saves the model; an incremental checkpoint appends the
+  input samples and the batch IDs of the run to the input log of the last full
+  checkpoint, from which the samples are replayed into the model when it's
+  loaded. A full checkpoint is made once the time spent replaying the log on
+  the loads since the last full checkpoint, including the next load, would
+  exceed the estimated time of a full checkpoint: a model that is swapped in
+  often, or that is small, is checkpointed in full more often than one that is
+  swapped in rarely, or that is big.
+
+  When the hand-off of snapshots is configured, an incremental checkpoint also
+  publishes a snapshot of the model if replaying the input log on the next
+  load would take longer than the last snapshot did; the next model runner of
+  the model attaches to the snapshot instead of loading the checkpoint, if the
+  snapshot has the ID of the current checkpoint.
   """
 
   # Name of the attribute that is stored as an integral component of the
@@ -548,19 +565,51 @@ class _ModelArchiver(object):
   # since the previous checkpoint.
   _BATCH_IDS_CHECKPOINT_ATTR_NAME = "batchIDs"
 
-  # Name of the attribute that is stored as an integral component of the
-  # checkpoint. It contains a list of ModelInputRow objects processed since
-  # the last full checkpoint for use in preparing the last incremental
-  # model checkpoint for new input. The value is in pickle string format.
+  # Name of the attribute that contained a list of ModelInputRow objects
+  # processed since the last full checkpoint, in pickle string format, in
+  # checkpoints saved before the input log replaced it; the samples of such a
+  # checkpoint are replayed before those of its input log.
   _INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME = "incrementalInputSamples"
 
-  _MAX_INCREMENTAL_CHECKPOINT_DATA_ROWS = 100
+  # Max number of input samples since the last full checkpoint, which bounds
+  # the time to replay them when the model is loaded
+  _MAX_INCREMENTAL_CHECKPOINT_DATA_ROWS = 1000
+
+  # Lower bound of the estimated time of a full checkpoint, which also covers
+  # the fsyncs of the checkpoint store
+  _MIN_FULL_CHECKPOINT_SEC = 0.05
+
+  # Name of the checkpoint attribute with the estimated times of a full
+  # checkpoint and of replaying an input sample, as of the full checkpoint; a
+  # dict with the _*_SEC_STAT_NAME keys and float or None (unknown) values
+  _CHECKPOINT_STATS_ATTR_NAME = "checkpointStats"
+  _FULL_CHECKPOINT_SEC_STAT_NAME = "fullCheckpointSec"
+  _REPLAY_SEC_PER_SAMPLE_STAT_NAME = "replaySecPerSample"
+  _SNAPSHOT_SEC_STAT_NAME = "snapshotSec"
+
+  # Name of the checkpoint attribute with the unique ID of the full checkpoint;
+  # each input log record has the ID of the incremental checkpoint. A snapshot
+  # is attached only if it has the ID of the last one of them.
+  _CHECKPOINT_ID_ATTR_NAME = "checkpointID"
+
+  # Keys of the input log records, which are pickled dicts: the batch IDs and
+  # the input samples of the run; the total time spent replaying the input log
+  # on loads since the last full checkpoint; the estimated times as of the
+  # run, like the _CHECKPOINT_STATS_ATTR_NAME attribute; and the checkpoint ID,
+  # which is absent from records appended before it was added
+  _LOG_BATCH_IDS_KEY = "batchIDs"
+  _LOG_INPUT_SAMPLES_KEY = "inputSamples"
+  _LOG_REPLAY_SEC_KEY = "replaySec"
+  _LOG_CHECKPOINT_STATS_KEY = "checkpointStats"
+  _LOG_CHECKPOINT_ID_KEY = "checkpointID"
 
 
   def __init__(self, modelID):
     """
     :param modelID: model ID; string
     """
+    self._logger = _getLogger()
+
     self._modelID = modelID
 
     # The model object from OPF ModelFactory; set up by the loadModel() method
@@ -581,6 +630,22 @@ class _ModelArchiver(object):
     # Input data samples that have accumulated since last full checkpoint
     self._inputSamplesSinceLastFullCheckpointCache = None
 
+    # Total time spent replaying the input samples on loads since the last
+    # full checkpoint; and the estimated time of a full checkpoint and replay
+    # time per input sample or None if unknown. Loaded with the input samples.
+    self._replaySec = 0.0
+    self._fullCheckpointSec = None
+    self._replaySecPerSample = None
+
+    # ID of the current checkpoint, None if unknown; and the estimated time of
+    # publishing a snapshot or None if unknown. Loaded with the input samples.
+    self._checkpointID = None
+    self._snapshotSec = None
+
+    self._snapshotHandoff = None
+    if ModelSnapshotHandoff.isEnabled():
+      self._snapshotHandoff = ModelSnapshotHandoff()
+
 
   @property
   def model(self):
@@ -622,39 +687,52 @@ class _ModelArchiver(object):
 
 
   @classmethod
-  def _encodeDataSamples(cls, dataSamples):
+  def _decodeDataSamples(cls, dataSamples):
     """
-    :param dataSamples: a sequence of data samples to be saved as the
+    :param dataSamples: string-encoded data samples from the
       _INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME checkpoint attribute
 
-    :returns: a string encoding of the data samples
+    :returns: a sequence of data samples
     """
-    return base64.standard_b64encode(pickle.dumps(dataSamples,
-                                                  pickle.HIGHEST_PROTOCOL))
+    return pickle.loads(base64.standard_b64decode(dataSamples))
 
 
   @classmethod
-  def _decodeDataSamples(cls, dataSamples):
+  def _encodeLogRecord(cls, logRecord):
     """
-    :param dataSamples: string-encoded data samples from the
-      _INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME checkpoint attribute
+    :param logRecord: a dict with the _LOG_*_KEY keys
 
-    :returns: a sequence of data samples
+    :returns: the record to append to the input log; a string
     """
-    return pickle.loads(base64.standard_b64decode(dataSamples))
+    return pickle.dumps(logRecord, pickle.HIGHEST_PROTOCOL)
+
+
+  @classmethod
+  def _decodeLogRecord(cls, record):
+    """
+    :param record: a record of the input log
+
+    :returns: a dict with the _LOG_*_KEY keys
+    """
+    return pickle.loads(record)
 
 
   def _loadCheckpointAttributes(self):
-    # Load the checkpoint attributes
+    # Load the checkpoint attributes and the input log
     try:
       checkpointAttributes = self._checkpointMgr.loadCheckpointAttributes(
         self._modelID)
+      logRecords = [
+        self._decodeLogRecord(record)
+        for record in self._checkpointMgr.loadCheckpointLog(self._modelID)]
     except model_checkpoint_mgr.ModelNotFound:
       self._modelCheckpointBatchIDSetCache = set()
       self._inputSamplesSinceLastFullCheckpoint = []
     else:
-      self._modelCheckpointBatchIDSetCache = set(
-        checkpointAttributes[self._BATCH_IDS_CHECKPOINT_ATTR_NAME])
+      self._setCheckpointStats(checkpointAttributes.get(
+        self._CHECKPOINT_STATS_ATTR_NAME))
+      self._checkpointID = checkpointAttributes.get(
+        self._CHECKPOINT_ID_ATTR_NAME)
 
       inputSamples = checkpointAttributes.get(
         self._INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME)
@@ -664,6 +742,49 @@ class _ModelArchiver(object):
       else:
         self._inputSamplesSinceLastFullCheckpoint = []
 
+      for logRecord in logRecords:
+        self._inputSamplesSinceLastFullCheckpoint.extend(
+          logRecord[self._LOG_INPUT_SAMPLES_KEY])
+
+      if logRecords:
+        lastLogRecord = logRecords[-1]
+        self._modelCheckpointBatchIDSetCache = set(
+          lastLogRecord[self._LOG_BATCH_IDS_KEY])
+        self._replaySec = lastLogRecord[self._LOG_REPLAY_SEC_KEY]
+        self._setCheckpointStats(
+          lastLogRecord[self._LOG_CHECKPOINT_STATS_KEY])
+        self._checkpointID = lastLogRecord.get(self._LOG_CHECKPOINT_ID_KEY)
+      else:
+        self._modelCheckpointBatchIDSetCache = set(
+          checkpointAttributes[self._BATCH_IDS_CHECKPOINT_ATTR_NAME])
+
+
+  def _getCheckpointStats(self):
+    """
+    :returns: the estimated times for the _CHECKPOINT_STATS_ATTR_NAME
+      checkpoint attribute
+    """
+    return {
+      self._FULL_CHECKPOINT_SEC_STAT_NAME: self._fullCheckpointSec,
+      self._REPLAY_SEC_PER_SAMPLE_STAT_NAME: self._replaySecPerSample,
+      self._SNAPSHOT_SEC_STAT_NAME: self._snapshotSec
+    }
+
+
+  def _setCheckpointStats(self, checkpointStats):
+    """
+    :param checkpointStats: value of the _CHECKPOINT_STATS_ATTR_NAME
+      checkpoint attribute; None in checkpoints saved before it was added
+    """
+    if checkpointStats is not None:
+      self._fullCheckpointSec = checkpointStats[
+        self._FULL_CHECKPOINT_SEC_STAT_NAME]
+      self._replaySecPerSample = checkpointStats[
+        self._REPLAY_SEC_PER_SAMPLE_STAT_NAME]
+      # Absent from the stats of checkpoints saved before the hand-off of
+      # snapshots was added
+      self._snapshotSec = checkpointStats.get(self._SNAPSHOT_SEC_STAT_NAME)
+
 
   def loadModel(self):
     """ Load the model and construct the input row encoder. On success,
@@ -676,9 +797,25 @@ class _ModelArchiver(object):
 
     modelDefinition = None
 
+    # Load the input samples to replay and the estimated times first, since
+    # loading the model updates the latter
+    inputSamples = self._inputSamplesSinceLastFullCheckpoint
+
     # Load the model
     try:
-      self._model = self._checkpointMgr.load(self._modelID)
+      self._model = self._attachSnapshot()
+      if self._model is not None:
+        # The snapshot has the input samples of the checkpoint already
+        inputSamples = []
+      else:
+        startTime = time.time()
+        self._model = self._checkpointMgr.load(self._modelID)
+
+        if self._fullCheckpointSec is None:
+          # Until a full checkpoint is timed, assume that saving the model
+          # takes about as long as loading it
+          self._fullCheckpointSec = time.time() - startTime
+
       self._hasCheckpoint = True
     except model_checkpoint_mgr.ModelNotFound:
       # So, we didn't have a checkpoint... try to create our model from model
@@ -721,7 +858,8 @@ class _ModelArchiver(object):
     self._inputRowEncoder = _InputRowEncoder(fieldsMeta=inputFieldsMeta)
 
     # If the checkpoint was incremental, feed the cached data into the model
-    for inputSample in self._inputSamplesSinceLastFullCheckpoint:
+    startTime = time.time()
+    for inputSample in inputSamples:
       # Convert a flat input sample into a format that is consumable by an OPF
       # model
       self._inputRowEncoder.appendRecord(inputSample)
@@ -729,6 +867,73 @@ class _ModelArchiver(object):
       # Infer
       self._model.run(self._inputRowEncoder.getNextRecordDict())
 
+    if inputSamples:
+      replaySec = time.time() - startTime
+      self._replaySec += replaySec
+      self._replaySecPerSample = replaySec / len(inputSamples)
+
+
+  def _attachSnapshot(self):
+    """ Attach to the snapshot that the previous model runner of the model
+    published, if the hand-off of snapshots is configured
+
+    :returns: the model from the snapshot; None if there's no snapshot of the
+      current checkpoint
+    """
+    if self._snapshotHandoff is None or self._checkpointID is None:
+      return None
+
+    try:
+      return self._snapshotHandoff.attach(self._modelID, self._checkpointID)
+    except Exception:  # pylint: disable=W0703
+      # The checkpoint is the state of the model, the snapshot is a shortcut
+      self._logger.warning("Failed to attach snapshot of model=%s; loading "
+                           "the checkpoint", self._modelID, exc_info=True)
+      return None
+
+
+  def _isSnapshotDue(self):
+    """ Decide whether to publish a snapshot with an incremental checkpoint
+
+    :returns: True if the hand-off of snapshots is configured and replaying the
+      input log on the next load would take longer than the last snapshot did
+    """
+    if self._snapshotHandoff is None:
+      return False
+
+    if self._snapshotSec is None or self._replaySecPerSample is None:
+      return True
+
+    return (len(self._inputSamplesSinceLastFullCheckpoint) *
+            self._replaySecPerSample > self._snapshotSec)
+
+
+  def _isFullCheckpointDue(self, numNewInputSamples):
+    """ Decide between a full and an incremental checkpoint
+
+    :param numNewInputSamples: number of input samples since the last
+      checkpoint
+
+    :returns: True if a full checkpoint is due
+    """
+    if not self._hasCheckpoint:
+      return True
+
+    numInputSamples = (len(self._inputSamplesSinceLastFullCheckpoint) +
+                       numNewInputSamples)
+    if numInputSamples > self._MAX_INCREMENTAL_CHECKPOINT_DATA_ROWS:
+      return True
+
+    if self._replaySecPerSample is None or self._fullCheckpointSec is None:
+      # No replay measured since the last full checkpoint
+      return False
+
+    # Replaying the input log again on the next load would cost more in total
+    # than a full checkpoint, which bounds the total to about twice the time
+    # of the full checkpoint (as in the ski rental problem)
+    return (self._replaySec + numInputSamples * self._replaySecPerSample >
+            max(self._fullCheckpointSec, self._MIN_FULL_CHECKPOINT_SEC))
+
 
   def saveModel(self, currentRunBatchIDSet, currentRunInputSamples):
     """
@@ -736,39 +941,78 @@ class _ModelArchiver(object):
       checkpoint attributes
 
     :param currentRunInputSamples: a sequence of model input data sample objects
-      for incremental checkpoint; will be saved in checkpoint attributes if an
-      incremental checkpoint is performed.
+      for incremental checkpoint; will be appended to the input log of the
+      checkpoint if an incremental checkpoint is performed.
     """
     if self._model is not None:
       self._modelCheckpointBatchIDSetCache = currentRunBatchIDSet.copy()
 
-      if (not self._hasCheckpoint or
-          (len(self._inputSamplesSinceLastFullCheckpoint) +
-           len(currentRunInputSamples)) >
-          self._MAX_INCREMENTAL_CHECKPOINT_DATA_ROWS):
+      self._checkpointID = uuid.uuid1().hex
+
+      if self._isFullCheckpointDue(len(currentRunInputSamples)):
         # Perform a full checkpoint
         self._inputSamplesSinceLastFullCheckpointCache = []
+        self._replaySec = 0.0
 
+        startTime = time.time()
         self._checkpointMgr.save(
           modelID=self._modelID, model=self._model,
           attributes={
             self._BATCH_IDS_CHECKPOINT_ATTR_NAME:
-              list(self._modelCheckpointBatchIDSetCache)})
+              list(self._modelCheckpointBatchIDSetCache),
+            self._CHECKPOINT_STATS_ATTR_NAME: self._getCheckpointStats(),
+            self._CHECKPOINT_ID_ATTR_NAME: self._checkpointID})
+        self._fullCheckpointSec = time.time() - startTime
 
         self._hasCheckpoint = True
+
+        # The attributes have the estimated times as of the previous full
+        # checkpoint; record the time of this one in the new input log, since
+        # the next model runner process would not know it otherwise
+        self._appendLogRecord(inputSamples=[])
       else:
         # Perform an incremental checkpoint
         self._inputSamplesSinceLastFullCheckpoint.extend(currentRunInputSamples)
-        attributes = {
-          self._BATCH_IDS_CHECKPOINT_ATTR_NAME:
-            list(self._modelCheckpointBatchIDSetCache),
 
-          self._INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME:
-            self._encodeDataSamples(self._inputSamplesSinceLastFullCheckpoint)
-        }
+        # The snapshot is published first, so that the checkpoint records its
+        # time; it's attached only once the checkpoint with its ID is saved
+        if self._isSnapshotDue():
+          self._publishSnapshot()
+
+        self._appendLogRecord(inputSamples=list(currentRunInputSamples))
 
-        self._checkpointMgr.updateCheckpointAttributes(self._modelID,
-                                                       attributes)
+
+  def _publishSnapshot(self):
+    """ Publish the snapshot of the model with the ID of the checkpoint that's
+    being saved and time it
+    """
+    startTime = time.time()
+    try:
+      self._snapshotHandoff.publish(self._modelID, self._model,
+                                    self._checkpointID)
+    except Exception:  # pylint: disable=W0703
+      # E.g., the RAM-backed filesystem is full; the next model runner will
+      # load the checkpoint
+      self._logger.warning("Failed to publish snapshot of model=%s",
+                           self._modelID, exc_info=True)
+    else:
+      self._snapshotSec = time.time() - startTime
+
+
+  def _appendLogRecord(self, inputSamples):
+    """ Append a record with the given input samples, the batch IDs and the
+    estimated times to the input log of the checkpoint
+    """
+    logRecord = {
+      self._LOG_BATCH_IDS_KEY: list(self._modelCheckpointBatchIDSetCache),
+      self._LOG_INPUT_SAMPLES_KEY: inputSamples,
+      self._LOG_REPLAY_SEC_KEY: self._replaySec,
+      self._LOG_CHECKPOINT_STATS_KEY: self._getCheckpointStats(),
+      self._LOG_CHECKPOINT_ID_KEY: self._checkpointID
+    }
+
+    self._checkpointMgr.appendCheckpointLog(
+      self._modelID, self._encodeLogRecord(logRecord))
 
 
 
@@ -40,6 +40,8 @@ import psutil
 
 from htmengine.htmengine_logging import getExtendedLogger, getStandardLogPrefix
 
+from htmengine.model_checkpoint_mgr.model_checkpoint_mgr import (
+  ModelCheckpointMgr, RamTierFlusher)
 from htmengine.model_swapper.swap_controller import SwapController
 
 from nta.utils.error_handling import abortProgramOnAnyException
@@ -51,6 +53,7 @@ _MODULE_NAME = "htmengine.model_swapper.model_scheduler_service"
 
 _MIN_CONCURRENCY = 2
 _SWAP_CONTROLLER_JOIN_TIMEOUT = 60
+_CHECKPOINT_FLUSHER_JOIN_TIMEOUT = 60
 _BASE_RAM_USAGE = 1073741824  # 1GB
 _RAM_PER_SLOT = 2147483648  # 2 GB
 
@@ -87,6 +90,12 @@ class ModelSchedulerService(object):
     # Create the slot agents and swap controller.
     self._swapController = SwapController(concurrency=concurrency)
 
+    # Persists the checkpoints that model runners save to the RAM tier of the
+    # model checkpoint archive, if configured
+    self._checkpointFlusher = None
+    if ModelCheckpointMgr.isRamTierEnabled():
+      self._checkpointFlusher = RamTierFlusher()
+
 
   def __enter__(self):
     """ Context Manager protocol method. Allows a ModelSchedulerService instance
@@ -137,6 +146,15 @@ class ModelSchedulerService(object):
     swapControllerThread.setDaemon(True)
     swapControllerThread.start()
 
+    checkpointFlusherThread = None
+    if self._checkpointFlusher is not None:
+      checkpointFlusherThread = threading.Thread(
+        target=self._runCheckpointFlusherThread,
+        name="%s-%s" % (self._checkpointFlusher.__class__.__name__,
+                        id(self._checkpointFlusher)))
+      checkpointFlusherThread.setDaemon(True)
+      checkpointFlusherThread.start()
+
     while True:
       try:
         signalnum = int(quitPipeFileObj.readline())
@@ -158,6 +176,15 @@ class ModelSchedulerService(object):
         "Swap controller thread did not join in the allotted time "
         "(%g seconds)." % _SWAP_CONTROLLER_JOIN_TIMEOUT)
 
+    # Stop the checkpoint flusher after the model runners, so that its last
+    # pass persists their final checkpoints
+    if checkpointFlusherThread is not None:
+      self._checkpointFlusher.requestStopTS()
+      checkpointFlusherThread.join(_CHECKPOINT_FLUSHER_JOIN_TIMEOUT)
+      assert not checkpointFlusherThread.isAlive(), (
+          "Checkpoint flusher thread did not join in the allotted time "
+          "(%g seconds)." % _CHECKPOINT_FLUSHER_JOIN_TIMEOUT)
+
     return signalnum == signal.SIGHUP
 
 
@@ -167,6 +194,12 @@ class ModelSchedulerService(object):
     self._swapController.run()
 
 
+  @abortProgramOnAnyException(
+    exitCode=_ABORT_PROGRAM_ON_THREAD_EXCEPTION_EXIT_CODE, logger=_getLogger())
+  def _runCheckpointFlusherThread(self):
+    self._checkpointFlusher.run()
+
+
   def _handleSignal(self, signalnum, _frame):
     """ Handle system signal; write it to the pipe so that it may be processed
     by the main thread.
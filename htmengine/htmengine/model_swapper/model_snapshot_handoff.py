@@ -0,0 +1,281 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+This module implements the hand-off of model snapshots between the Model Runner
+processes of a host: a Model Runner that stops publishes the state of its model
+in shared memory, and the next Model Runner of the model attaches to it instead
+of loading the checkpoint and replaying its input log.
+"""
+
+import errno
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+from nupic.frameworks.opf.modelfactory import ModelFactory
+
+from htmengine.htmengine_logging import getExtendedLogger
+from htmengine.model_swapper import ModelSwapperConfig
+
+from nta.utils import makeDirectoryFromAbsolutePath
+
+
+
+_MODULE_NAME = "htmengine.model_swapper.model_snapshot_handoff"
+
+
+
+def _getLogger():
+  return getExtendedLogger(_MODULE_NAME)
+
+
+
+class ModelSnapshotHandoff(object):
+  """ Hands off model snapshots between Model Runners through a directory on a
+  RAM-backed filesystem, such as /dev/shm, which is where named shared memory
+  segments live on Linux. The snapshot of a model is the model saved without
+  fsync, and it's never persisted: the checkpoint in ModelCheckpointMgr remains
+  the durable state of the model.
+
+  Layout of the hand-off root (handoff_root option of model-swapper.conf):
+
+  <handoff_root>
+    .scratch/ (snapshots being published or attached)
+    .sweep (marker; mtime is the time of the last pass over stale snapshots)
+    <model ID>/ (the published snapshot of the model)
+      snapshot.json (the ID of the checkpoint that the snapshot is equal to)
+      model_instance/ (the contents are generated by CLA model)
+
+  A snapshot is tagged with the ID of the checkpoint that the publisher saved
+  along with it; attach() consumes the snapshot and returns its model only if
+  the tag matches the current checkpoint, so a snapshot that was superseded by
+  a later checkpoint, or whose checkpoint failed, is never used. Snapshots that
+  aren't attached within handoff_max_age_sec, e.g., of models that no longer
+  receive input, are deleted by publish().
+  """
+
+  _SCRATCH_DIR_NAME = ".scratch"
+  _SWEEP_MARKER_NAME = ".sweep"
+  _SNAPSHOT_INFO_FILE_NAME = "snapshot.json"
+  _SNAPSHOT_INSTANCE_DIR_NAME = "model_instance"
+
+  _CHECKPOINT_ID_KEY = "checkpointID"
+
+  _DEFAULT_MAX_AGE_SEC = 300
+
+
+  def __init__(self):
+    self._logger = _getLogger()
+
+    self._root, self._maxAgeSec = self._getConfig()
+    if self._root is None:
+      raise ValueError("Model snapshot hand-off is not configured")
+
+    self._scratchDir = os.path.join(self._root, self._SCRATCH_DIR_NAME)
+    if not os.path.exists(self._scratchDir):
+      makeDirectoryFromAbsolutePath(self._scratchDir)
+
+
+  @classmethod
+  def _getConfig(cls):
+    """ Get the hand-off options of model-swapper.conf
+
+    :returns: (root, maxAgeSec); (None, None) if the optional handoff_root
+      option is omitted or empty
+    """
+    config = ModelSwapperConfig()
+    if (not config.has_option("model_runner", "handoff_root") or
+        not config.get("model_runner", "handoff_root").strip()):
+      return None, None
+
+    root = os.path.expanduser(os.path.expandvars(
+      config.get("model_runner", "handoff_root").strip()))
+    if not os.path.isabs(root):
+      raise ValueError("Model snapshot hand-off root path is not absolute: %r"
+                       % (root,))
+
+    maxAgeSec = cls._DEFAULT_MAX_AGE_SEC
+    if config.has_option("model_runner", "handoff_max_age_sec"):
+      maxAgeSec = config.getfloat("model_runner", "handoff_max_age_sec")
+
+    if maxAgeSec <= 0:
+      raise ValueError("Model snapshot handoff_max_age_sec=%r must be positive"
+                       % (maxAgeSec,))
+
+    return os.path.realpath(root), maxAgeSec
+
+
+  @classmethod
+  def isEnabled(cls):
+    """ Whether model-swapper.conf configures the hand-off of snapshots """
+    return cls._getConfig()[0] is not None
+
+
+  def publish(self, modelID, model, checkpointID):
+    """ Publish the snapshot of a model, replacing its unattached one, if any
+
+    :param modelID: unique model ID hex string
+    :param model: an OPF model instance object
+    :param checkpointID: ID of the checkpoint of the model that the snapshot
+      is equal to
+    """
+    startTime = time.time()
+
+    tempSnapshotDirPath = tempfile.mkdtemp(prefix=modelID, dir=self._scratchDir)
+    try:
+      with open(os.path.join(tempSnapshotDirPath,
+                             self._SNAPSHOT_INFO_FILE_NAME), "w") as fileObj:
+        json.dump({self._CHECKPOINT_ID_KEY: checkpointID}, fileObj)
+
+      model.save(saveModelDir=os.path.join(tempSnapshotDirPath,
+                                           self._SNAPSHOT_INSTANCE_DIR_NAME))
+
+      snapshotDirPath = os.path.join(self._root, modelID)
+      self._remove(snapshotDirPath)
+      os.rename(tempSnapshotDirPath, snapshotDirPath)
+    except:
+      shutil.rmtree(tempSnapshotDirPath, ignore_errors=True)
+      raise
+
+    self._logger.info(
+      "{TAG:SNAPSHOT.PUBLISH} Published snapshot of model=%s: duration=%ss; "
+      "checkpointID=%s", modelID, time.time() - startTime, checkpointID)
+
+    self._removeStaleSnapshotsIfDue()
+
+
+  def attach(self, modelID, checkpointID):
+    """ Consume the published snapshot of a model
+
+    :param modelID: unique model ID hex string
+    :param checkpointID: ID of the current checkpoint of the model
+
+    :returns: an OPF model instance from the snapshot; None if the model has
+      no snapshot that is equal to the given checkpoint
+    """
+    startTime = time.time()
+
+    # Take the snapshot, so that it's attached at most once and isn't deleted
+    # by a pass over stale snapshots while it's loaded
+    snapshotDirPath = os.path.join(self._scratchDir,
+                                   "%s.%s" % (modelID, uuid.uuid1().hex))
+    try:
+      os.rename(os.path.join(self._root, modelID), snapshotDirPath)
+    except OSError as e:
+      if e.errno == errno.ENOENT:
+        return None
+      raise
+
+    try:
+      with open(os.path.join(snapshotDirPath,
+                             self._SNAPSHOT_INFO_FILE_NAME)) as fileObj:
+        snapshotCheckpointID = json.load(fileObj)[self._CHECKPOINT_ID_KEY]
+
+      if snapshotCheckpointID != checkpointID:
+        self._logger.info(
+          "Discarding snapshot of model=%s: snapshot checkpointID=%s, current "
+          "checkpointID=%s", modelID, snapshotCheckpointID, checkpointID)
+        return None
+
+      model = ModelFactory.loadFromCheckpoint(
+        os.path.join(snapshotDirPath, self._SNAPSHOT_INSTANCE_DIR_NAME))
+    finally:
+      shutil.rmtree(snapshotDirPath, ignore_errors=True)
+
+    self._logger.info(
+      "{TAG:SNAPSHOT.ATTACH} Attached snapshot of model=%s: duration=%ss; "
+      "checkpointID=%s", modelID, time.time() - startTime, checkpointID)
+
+    return model
+
+
+  def _removeStaleSnapshotsIfDue(self):
+    """ Delete the snapshots and the scratch directories that are older than
+    handoff_max_age_sec, at most once per quarter of it across all processes
+    """
+    markerPath = os.path.join(self._root, self._SWEEP_MARKER_NAME)
+    now = time.time()
+    try:
+      if now - os.stat(markerPath).st_mtime < self._maxAgeSec / 4.0:
+        return
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        raise
+
+    with open(markerPath, "a"):
+      os.utime(markerPath, None)
+
+    self.removeStaleSnapshots()
+
+
+  def removeStaleSnapshots(self):
+    """ Delete the snapshots and the scratch directories that are older than
+    handoff_max_age_sec
+
+    :returns: number of snapshots deleted
+    """
+    now = time.time()
+    numRemoved = 0
+    for parentDirPath in (self._root, self._scratchDir):
+      for name in os.listdir(parentDirPath):
+        if name.startswith("."):
+          continue
+
+        # The ctime of a directory is updated when it's renamed, so that an
+        # old snapshot isn't deleted while it's attached
+        path = os.path.join(parentDirPath, name)
+        try:
+          if now - os.lstat(path).st_ctime < self._maxAgeSec:
+            continue
+        except OSError as e:
+          if e.errno == errno.ENOENT:
+            # Attached or replaced in the meantime
+            continue
+          raise
+
+        if parentDirPath == self._root:
+          self._logger.info("Deleting stale snapshot of model=%s", name)
+          numRemoved += 1
+
+        self._remove(path)
+
+    return numRemoved
+
+
+  def _remove(self, snapshotDirPath):
+    """ Delete a snapshot directory unless it doesn't exist; it's renamed into
+    the scratch directory first, so that it's never seen partially deleted
+    """
+    tempPath = os.path.join(
+      self._scratchDir,
+      "%s.%s" % (os.path.basename(snapshotDirPath), uuid.uuid1().hex))
+    try:
+      os.rename(snapshotDirPath, tempPath)
+    except OSError as e:
+      if e.errno == errno.ENOENT:
+        return
+      raise
+
+    shutil.rmtree(tempPath, ignore_errors=True)
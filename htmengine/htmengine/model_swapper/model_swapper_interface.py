@@ -795,6 +795,18 @@ class ModelSwapperInterface(object):
       if mq.startswith(prefix) and safeIsInputPending(mq))
 
 
+  def getModelIDsWithInputQueues(self):
+    """ Get model IDs of all models that have an input queue, whether or not
+    input is pending
+
+    :returns: (possibly empty) sequence of model IDs
+    """
+    prefix = self._modelInputQueueNamePrefix
+    return tuple(self._getModelIDFromInputQName(mq)
+                 for mq in self._bus.getAllMessageQueues()
+                 if mq.startswith(prefix))
+
+
   def submitRequests(self, modelID, requests):
     """
     Submit a batch of requests for processing by a model with the given modelID.
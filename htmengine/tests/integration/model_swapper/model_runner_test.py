@@ -257,21 +257,25 @@ class ModelRunnerIntTestCase(unittest.TestCase):
       del model
 
       attrs = checkpointMgr.loadCheckpointAttributes(modelID)
-      self.assertIn(model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME,
-                    attrs, msg=repr(attrs))
-      self.assertSequenceEqual(
-        attrs[model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME],
-        [inputBatchID], msg=repr(attrs))
-
-      self.assertIn(
+      self.assertNotIn(
         model_runner._ModelArchiver._INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME,
         attrs, msg=repr(attrs))
 
+      logRecords = [
+        model_runner._ModelArchiver._decodeLogRecord(record)
+        for record in checkpointMgr.loadCheckpointLog(modelID)]
+      # The record of the estimated times of the full checkpoint and the
+      # record of the run
+      self.assertEqual(len(logRecords), 2, msg=repr(logRecords))
+      self.assertSequenceEqual(
+        logRecords[0][model_runner._ModelArchiver._LOG_INPUT_SAMPLES_KEY],
+        [], msg=repr(logRecords))
+      self.assertSequenceEqual(
+        logRecords[1][model_runner._ModelArchiver._LOG_BATCH_IDS_KEY],
+        [inputBatchID], msg=repr(logRecords))
       self.assertSequenceEqual(
-        model_runner._ModelArchiver._decodeDataSamples(
-          attrs[model_runner._ModelArchiver.
-                _INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME]),
-        [row.data for row in inputRows2], msg=repr(attrs))
+        logRecords[1][model_runner._ModelArchiver._LOG_INPUT_SAMPLES_KEY],
+        [row.data for row in inputRows2], msg=repr(logRecords))
 
       # Final run with incremental checkpointing
       inputRows3 = [
@@ -306,23 +310,20 @@ class ModelRunnerIntTestCase(unittest.TestCase):
       model = checkpointMgr.load(modelID)
       del model
 
-      attrs = checkpointMgr.loadCheckpointAttributes(modelID)
-
-      self.assertIn(model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME,
-                    attrs, msg=repr(attrs))
+      logRecords = [
+        model_runner._ModelArchiver._decodeLogRecord(record)
+        for record in checkpointMgr.loadCheckpointLog(modelID)]
+      self.assertEqual(len(logRecords), 3, msg=repr(logRecords))
       self.assertSequenceEqual(
-        attrs[model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME],
-        [inputBatchID], msg=repr(attrs))
-
-      self.assertIn(
-        model_runner._ModelArchiver._INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME,
-        attrs, msg=repr(attrs))
+        logRecords[-1][model_runner._ModelArchiver._LOG_BATCH_IDS_KEY],
+        [inputBatchID], msg=repr(logRecords))
       self.assertSequenceEqual(
-        model_runner._ModelArchiver._decodeDataSamples(
-          attrs[model_runner._ModelArchiver.
-                _INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME]),
+        [sample
+         for logRecord in logRecords
+         for sample in logRecord[
+           model_runner._ModelArchiver._LOG_INPUT_SAMPLES_KEY]],
         [row.data for row in itertools.chain(inputRows2, inputRows3)],
-        msg=repr(attrs))
+        msg=repr(logRecords))
 
       # Delete the model
       _LOGGER.info("Deleting the model=%s", modelID)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Benchmark ModelCheckpointMgr with the flat and the hashed archive layouts:
+define() of all models, save() and loadCheckpointAttributes() of a sample of
+them with a stub model that saves a small file, getModelIDs(), and the online
+migration of the flat archive to the hashed layout.
+
+The archive is created in a temporary directory under --dir, which should be
+on the filesystem of the production archive, since directory and fsync costs
+depend on it.
+"""
+
+from optparse import OptionParser
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+
+from mock import patch
+
+from htmengine.model_checkpoint_mgr.model_checkpoint_mgr import (
+  ModelCheckpointMgr)
+
+
+
+class _StubModel(object):
+
+  def save(self, saveModelDir):  # pylint: disable=R0201
+    os.mkdir(saveModelDir)
+    with open(os.path.join(saveModelDir, "model.pkl"), "wb") as fileObj:
+      fileObj.write("x" * 4096)
+
+
+
+def _parseArgs():
+  parser = OptionParser(usage="%prog [options]\n\n" + __doc__.strip())
+
+  parser.add_option("--models", default="10000,100000", dest="models",
+                    help=("Comma-separated numbers of models "
+                          "[default: %default]"))
+  parser.add_option("--samples", type="int", default=1000, dest="numSamples",
+                    help=("Number of models that are saved and read "
+                          "[default: %default]"))
+  parser.add_option("--dir", default=None, dest="parentDir",
+                    help=("Directory in which to create the archive "
+                          "[default: the system's temporary directory]"))
+
+  options, remainingArgs = parser.parse_args()
+  if remainingArgs:
+    parser.error("Unexpected remaining args: %r" % (remainingArgs,))
+
+  return dict(models=[int(value) for value in options.models.split(",")],
+              numSamples=options.numSamples,
+              parentDir=options.parentDir)
+
+
+
+def _createCheckpointMgr(storageRoot, layoutVersion):
+  with patch.object(ModelCheckpointMgr, "_getStorageRoot",
+                    return_value=storageRoot), \
+      patch.object(ModelCheckpointMgr, "_getConfiguredLayoutVersion",
+                   return_value=layoutVersion):
+    return ModelCheckpointMgr()
+
+
+
+def _timePerCall(func, args):
+  """
+  :returns: milliseconds per call
+  """
+  start = time.time()
+  for arg in args:
+    func(arg)
+  return (time.time() - start) * 1000.0 / len(args)
+
+
+
+def _benchmarkLayout(storageRoot, layoutName, modelIDs, sampleModelIDs):
+  checkpointMgr = _createCheckpointMgr(
+    storageRoot, ModelCheckpointMgr._LAYOUT_VERSIONS_BY_NAME[layoutName])
+
+  defineMs = _timePerCall(
+    lambda modelID: checkpointMgr.define(modelID, definition={}), modelIDs)
+
+  saveMs = _timePerCall(
+    lambda modelID: checkpointMgr.save(modelID, _StubModel(), attributes={}),
+    sampleModelIDs)
+
+  loadMs = _timePerCall(checkpointMgr.loadCheckpointAttributes,
+                        sampleModelIDs)
+
+  start = time.time()
+  numModelIDs = len(checkpointMgr.getModelIDs())
+  getModelIDsSec = time.time() - start
+  assert numModelIDs == len(modelIDs), (numModelIDs, len(modelIDs))
+
+  print "%-8d %-9s %11.2f %9.2f %9.2f %15.2f %7d" % (
+    len(modelIDs), layoutName, defineMs, saveMs, loadMs, getModelIDsSec,
+    len(os.listdir(storageRoot)))
+
+  return checkpointMgr
+
+
+
+def main(models, numSamples, parentDir):
+  print "%-8s %-9s %11s %9s %9s %15s %7s" % ("models", "layout", "define(ms)",
+                                             "save(ms)", "load(ms)",
+                                             "getModelIDs(s)", "rootDir")
+
+  for numModels in models:
+    rnd = random.Random(42)
+    modelIDs = [uuid.UUID(int=rnd.getrandbits(128)).hex
+                for _ in xrange(numModels)]
+    sampleModelIDs = rnd.sample(modelIDs, min(numSamples, numModels))
+
+    for layoutName in ("flat", "hashed"):
+      tempDir = tempfile.mkdtemp(dir=parentDir)
+      try:
+        storageRoot = os.path.join(tempDir, "root")
+        checkpointMgr = _benchmarkLayout(storageRoot, layoutName, modelIDs,
+                                         sampleModelIDs)
+
+        if layoutName == "flat":
+          start = time.time()
+          numMigrated = checkpointMgr.migrateToHashedLayout()
+          print "%-8d migrated %d entries to the hashed layout in %.2fs" % (
+            numModels, numMigrated, time.time() - start)
+      finally:
+        shutil.rmtree(tempDir)
+
+
+
+if __name__ == "__main__":
+  main(**_parseArgs())
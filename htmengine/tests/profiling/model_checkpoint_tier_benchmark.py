@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Benchmark the swap latency of ModelCheckpointMgr with checkpoints saved
+directly to the archive versus saved to the RAM tier and persisted by a
+RamTierFlusher in a background thread, as in the model scheduler service.
+
+Each swap saves the checkpoint of one model (swap-out) and loads the checkpoint
+of another one (swap-in); the stub model saves a file of --size MB. Prints the
+median and 95th percentile latencies of both, the max number of unpersisted
+checkpoints during the run and the time for the flusher to persist the rest
+after the last swap.
+
+The archive is created in a temporary directory under --dir, which should be
+on the filesystem of the production archive; the RAM tier under --ram-dir.
+"""
+
+from optparse import OptionParser
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from mock import patch
+
+from htmengine.model_checkpoint_mgr.model_checkpoint_mgr import (
+  ModelCheckpointMgr, RamTierFlusher)
+from nupic.frameworks.opf.modelfactory import ModelFactory
+
+
+
+class _StubModel(object):
+
+  def __init__(self, data):
+    self._data = data
+
+
+  def save(self, saveModelDir):
+    os.mkdir(saveModelDir)
+    with open(os.path.join(saveModelDir, "model.pkl"), "wb") as fileObj:
+      fileObj.write(self._data)
+
+
+
+def _loadStubModel(checkpointDir):
+  with open(os.path.join(checkpointDir, "model.pkl"), "rb") as fileObj:
+    return fileObj.read()
+
+
+
+def _parseArgs():
+  parser = OptionParser(usage="%prog [options]\n\n" + __doc__.strip())
+
+  parser.add_option("--models", type="int", default=50, dest="numModels",
+                    help="Number of models [default: %default]")
+  parser.add_option("--swaps", type="int", default=500, dest="numSwaps",
+                    help="Number of swaps [default: %default]")
+  parser.add_option("--size", type="float", default=4, dest="sizeMB",
+                    help="Size of a checkpoint in MB [default: %default]")
+  parser.add_option("--dir", default=None, dest="parentDir",
+                    help=("Directory in which to create the archive "
+                          "[default: the system's temporary directory]"))
+  parser.add_option("--ram-dir", default="/dev/shm", dest="ramParentDir",
+                    help=("Directory in which to create the RAM tier "
+                          "[default: %default]"))
+
+  options, remainingArgs = parser.parse_args()
+  if remainingArgs:
+    parser.error("Unexpected remaining args: %r" % (remainingArgs,))
+
+  return dict(numModels=options.numModels,
+              numSwaps=options.numSwaps,
+              sizeMB=options.sizeMB,
+              parentDir=options.parentDir,
+              ramParentDir=options.ramParentDir)
+
+
+
+def _percentile(values, percent):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+
+def _countDirtyCheckpoints(ramRoot):
+  return len(os.listdir(os.path.join(
+    ramRoot, ModelCheckpointMgr._RAM_TIER_DIRTY_DIR_NAME)))
+
+
+
+def _runSwaps(checkpointMgr, modelIDs, numSwaps, data, ramRoot):
+  """
+  :returns: (saveMsList, loadMsList, maxDirtyCheckpoints)
+  """
+  rnd = random.Random(42)
+  saveMsList = []
+  loadMsList = []
+  maxDirty = 0
+  for _ in xrange(numSwaps):
+    outModelID, inModelID = rnd.sample(modelIDs, 2)
+
+    start = time.time()
+    checkpointMgr.save(outModelID, _StubModel(data), attributes={})
+    saveMsList.append((time.time() - start) * 1000.0)
+
+    start = time.time()
+    assert len(checkpointMgr.load(inModelID)) == len(data)
+    loadMsList.append((time.time() - start) * 1000.0)
+
+    if ramRoot is not None:
+      maxDirty = max(maxDirty, _countDirtyCheckpoints(ramRoot))
+
+  return saveMsList, loadMsList, maxDirty
+
+
+
+def _benchmarkMode(mode, numModels, numSwaps, data, tempDir, ramTempDir):
+  if mode == "tiered":
+    ramRoot = os.path.join(ramTempDir, "ram")
+    ramTierConfig = (ramRoot, 30, 1000)
+  else:
+    ramRoot = None
+    ramTierConfig = (None, None, None)
+
+  with patch.object(ModelCheckpointMgr, "_getStorageRoot",
+                    return_value=os.path.join(tempDir, "root")), \
+      patch.object(ModelCheckpointMgr, "_getRamTierConfig",
+                   return_value=ramTierConfig):
+    checkpointMgr = ModelCheckpointMgr()
+
+    modelIDs = [uuid.uuid1().hex for _ in xrange(numModels)]
+    for modelID in modelIDs:
+      checkpointMgr.define(modelID, definition={})
+      checkpointMgr.save(modelID, _StubModel(data), attributes={})
+
+    flusherThread = None
+    if ramRoot is not None:
+      checkpointMgr.flushRamTier()
+      flusher = RamTierFlusher()
+      flusherThread = threading.Thread(target=flusher.run,
+                                       name="RamTierFlusher")
+      flusherThread.start()
+
+    try:
+      saveMsList, loadMsList, maxDirty = _runSwaps(
+        checkpointMgr, modelIDs, numSwaps, data, ramRoot)
+    finally:
+      drainSec = 0.0
+      if flusherThread is not None:
+        start = time.time()
+        flusher.requestStopTS()
+        flusherThread.join()
+        drainSec = time.time() - start
+
+  if ramRoot is not None:
+    assert _countDirtyCheckpoints(ramRoot) == 0
+
+  print "%-7s %10.2f %10.2f %10.2f %10.2f %9d %9.2f" % (
+    mode, _percentile(saveMsList, 50), _percentile(saveMsList, 95),
+    _percentile(loadMsList, 50), _percentile(loadMsList, 95), maxDirty,
+    drainSec)
+
+
+
+def main(numModels, numSwaps, sizeMB, parentDir, ramParentDir):
+  data = os.urandom(int(sizeMB * 1024 * 1024))
+
+  print "%-7s %10s %10s %10s %10s %9s %9s" % ("mode", "save-p50", "save-p95",
+                                              "load-p50", "load-p95",
+                                              "maxDirty", "drain(s)")
+  with patch.object(ModelFactory, "loadFromCheckpoint",
+                    side_effect=_loadStubModel):
+    for mode in ("direct", "tiered"):
+      tempDir = tempfile.mkdtemp(dir=parentDir)
+      ramTempDir = tempfile.mkdtemp(dir=ramParentDir)
+      try:
+        _benchmarkMode(mode, numModels, numSwaps, data, tempDir, ramTempDir)
+      finally:
+        shutil.rmtree(tempDir)
+        shutil.rmtree(ramTempDir)
+
+
+
+if __name__ == "__main__":
+  main(**_parseArgs())
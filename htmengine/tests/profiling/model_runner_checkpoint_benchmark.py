@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Benchmark the checkpoints of the model runner under a thrashing swap workload:
+the models are swapped in round robin, each for a few input rows, with a new
+_ModelArchiver per swap like a new model_runner process. Compares the input
+log of incremental checkpoints with the previous scheme, which rewrote the
+input samples since the last full checkpoint into the checkpoint attributes
+with each incremental checkpoint and made a full checkpoint every 100 samples.
+
+The stub model saves a file of --size MB, takes --save-ms to serialize itself
+before writing it and --run-ms per input row.
+Prints the bytes passed to write() and the bytes written to storage per
+processed row, as reported by /proc/self/io, the number of full checkpoints,
+the input rows replayed per swap-in and the time per swap.
+
+The archive is created in a temporary directory under --dir, which should be
+on the filesystem of the production archive.
+"""
+
+import base64
+import cPickle as pickle
+import logging
+from optparse import OptionParser
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+from mock import patch
+
+from nupic.frameworks.opf.modelfactory import ModelFactory
+
+from htmengine.model_checkpoint_mgr.model_checkpoint_mgr import (
+  ModelCheckpointMgr)
+from htmengine.model_swapper import model_runner
+
+
+
+class _StubModelResult(object):
+
+  def __init__(self, inferences):
+    self.inferences = inferences
+
+
+
+class _StubModel(object):
+
+  def __init__(self, data, runSec, saveSec):
+    self._data = data
+    self._runSec = runSec
+    self._saveSec = saveSec
+    self.numRows = 0
+
+
+  def run(self, inputRecord):  # pylint: disable=W0613
+    self.numRows += 1
+    time.sleep(self._runSec)
+    return _StubModelResult(inferences={"anomalyScore": 0.0})
+
+
+  def save(self, saveModelDir):
+    time.sleep(self._saveSec)
+    os.mkdir(saveModelDir)
+    with open(os.path.join(saveModelDir, "model.pkl"), "wb") as fileObj:
+      fileObj.write(self._data)
+
+
+
+def _loadStubModel(savedModelDir, runSec, saveSec):
+  with open(os.path.join(savedModelDir, "model.pkl"), "rb") as fileObj:
+    return _StubModel(fileObj.read(), runSec, saveSec)
+
+
+
+class _AttributesModelArchiver(model_runner._ModelArchiver):
+  """ The previous incremental checkpoints, for comparison: all input samples
+  since the last full checkpoint in the checkpoint attributes
+  """
+
+  _MAX_INCREMENTAL_CHECKPOINT_DATA_ROWS = 100
+
+
+  def saveModel(self, currentRunBatchIDSet, currentRunInputSamples):
+    self._modelCheckpointBatchIDSetCache = currentRunBatchIDSet.copy()
+
+    if (not self._hasCheckpoint or
+        (len(self._inputSamplesSinceLastFullCheckpoint) +
+         len(currentRunInputSamples)) >
+        self._MAX_INCREMENTAL_CHECKPOINT_DATA_ROWS):
+      self._inputSamplesSinceLastFullCheckpointCache = []
+
+      self._checkpointMgr.save(
+        modelID=self._modelID, model=self._model,
+        attributes={
+          self._BATCH_IDS_CHECKPOINT_ATTR_NAME:
+            list(self._modelCheckpointBatchIDSetCache)})
+
+      self._hasCheckpoint = True
+    else:
+      self._inputSamplesSinceLastFullCheckpoint.extend(currentRunInputSamples)
+      self._checkpointMgr.updateCheckpointAttributes(
+        self._modelID,
+        {
+          self._BATCH_IDS_CHECKPOINT_ATTR_NAME:
+            list(self._modelCheckpointBatchIDSetCache),
+
+          self._INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME:
+            base64.standard_b64encode(pickle.dumps(
+              self._inputSamplesSinceLastFullCheckpoint,
+              pickle.HIGHEST_PROTOCOL))
+        })
+
+
+
+def _parseArgs():
+  parser = OptionParser(usage="%prog [options]\n\n" + __doc__.strip())
+
+  parser.add_option("--models", type="int", default=20, dest="numModels",
+                    help="Number of models [default: %default]")
+  parser.add_option("--swaps", type="int", default=400, dest="numSwaps",
+                    help="Number of swaps [default: %default]")
+  parser.add_option("--rows-per-swap", default="2,10,40", dest="rowsPerSwap",
+                    help=("Comma-separated numbers of input rows per swap "
+                          "[default: %default]"))
+  parser.add_option("--size", type="float", default=1, dest="sizeMB",
+                    help="Size of a checkpoint in MB [default: %default]")
+  parser.add_option("--run-ms", type="float", default=1, dest="runMs",
+                    help=("Time of the model per input row in ms "
+                          "[default: %default]"))
+  parser.add_option("--save-ms", type="float", default=0, dest="saveMs",
+                    help=("Time of the model to serialize itself in ms "
+                          "[default: %default]"))
+  parser.add_option("--dir", default=None, dest="parentDir",
+                    help=("Directory in which to create the archive "
+                          "[default: the system's temporary directory]"))
+
+  options, remainingArgs = parser.parse_args()
+  if remainingArgs:
+    parser.error("Unexpected remaining args: %r" % (remainingArgs,))
+
+  return dict(numModels=options.numModels,
+              numSwaps=options.numSwaps,
+              rowsPerSwap=[int(value)
+                           for value in options.rowsPerSwap.split(",")],
+              sizeMB=options.sizeMB,
+              runSec=options.runMs / 1000.0,
+              saveSec=options.saveMs / 1000.0,
+              parentDir=options.parentDir)
+
+
+
+def _getWrittenBytes():
+  """
+  :returns: (bytes passed to write(), bytes written to storage) by this
+    process so far
+  """
+  counters = dict()
+  with open("/proc/self/io") as fileObj:
+    for line in fileObj:
+      name, value = line.split(":")
+      counters[name] = int(value)
+
+  return counters["wchar"], counters["write_bytes"]
+
+
+
+def _runSwaps(archiverClass, modelIDs, numSwaps, rowsPerSwap):
+  """
+  :returns: (numFullCheckpoints, numReplayedRows)
+  """
+  stats = dict(numFullCheckpoints=0, numReplayedRows=0)
+
+  originalSave = ModelCheckpointMgr.save
+  def countingSave(checkpointMgr, *args, **kwargs):
+    stats["numFullCheckpoints"] += 1
+    return originalSave(checkpointMgr, *args, **kwargs)
+
+  with patch.object(ModelCheckpointMgr, "save", autospec=True,
+                    side_effect=countingSave):
+    for swap in xrange(numSwaps):
+      modelID = modelIDs[swap % len(modelIDs)]
+
+      # A new model runner process per swap
+      archiver = archiverClass(modelID)
+      archiver.modelCheckpointBatchIDSet  # pylint: disable=W0104
+      archiver.loadModel()
+      stats["numReplayedRows"] += archiver.model.numRows
+
+      inputSamples = []
+      for i in xrange(rowsPerSwap):
+        inputSample = [float(swap * rowsPerSwap + i)]
+        archiver.inputRowEncoder.appendRecord(inputSample)
+        archiver.model.run(archiver.inputRowEncoder.getNextRecordDict())
+        inputSamples.append(inputSample)
+
+      archiver.saveModel(currentRunBatchIDSet=set([uuid.uuid1().hex]),
+                         currentRunInputSamples=inputSamples)
+
+  return stats["numFullCheckpoints"], stats["numReplayedRows"]
+
+
+
+def _benchmarkArchiver(archiverName, archiverClass, numModels, numSwaps,
+                       rowsPerSwap, data, runSec, saveSec, tempDir):
+  with patch.object(ModelCheckpointMgr, "_getStorageRoot",
+                    return_value=os.path.join(tempDir, "root")), \
+      patch.object(ModelCheckpointMgr, "_getRamTierConfig",
+                   return_value=(None, None, None)), \
+      patch.object(ModelFactory, "loadFromCheckpoint",
+                   side_effect=lambda savedModelDir: _loadStubModel(
+                     savedModelDir, runSec, saveSec)):
+    checkpointMgr = ModelCheckpointMgr()
+    modelIDs = [uuid.uuid1().hex for _ in xrange(numModels)]
+    for modelID in modelIDs:
+      checkpointMgr.define(modelID, definition=dict(
+        inputSchema=[("c1", "float", "")]))
+      checkpointMgr.save(modelID, _StubModel(data, runSec, saveSec),
+                         attributes={
+                           model_runner._ModelArchiver.
+                           _BATCH_IDS_CHECKPOINT_ATTR_NAME: []})
+
+    os.system("sync")
+    startWchar, startWriteBytes = _getWrittenBytes()
+    start = time.time()
+
+    numFullCheckpoints, numReplayedRows = _runSwaps(archiverClass, modelIDs,
+                                                    numSwaps, rowsPerSwap)
+
+    duration = time.time() - start
+    endWchar, endWriteBytes = _getWrittenBytes()
+
+  numRows = float(numSwaps * rowsPerSwap)
+  print "%-9d %-11s %11.0f %14.0f %10d %14.1f %12.1f" % (
+    rowsPerSwap, archiverName, (endWchar - startWchar) / numRows,
+    (endWriteBytes - startWriteBytes) / numRows, numFullCheckpoints,
+    numReplayedRows / float(numSwaps), duration * 1000.0 / numSwaps)
+
+
+
+def main(numModels, numSwaps, rowsPerSwap, sizeMB, runSec, saveSec,
+         parentDir):
+  # Log output would be counted as written bytes
+  logging.disable(logging.CRITICAL)
+
+  data = os.urandom(int(sizeMB * 1024 * 1024))
+
+  print "%-9s %-11s %11s %14s %10s %14s %12s" % (
+    "rows/swap", "checkpoint", "bytes/row", "diskBytes/row", "full",
+    "replayed/swap", "ms/swap")
+  for numRows in rowsPerSwap:
+    for archiverName, archiverClass in (
+        ("attributes", _AttributesModelArchiver),
+        ("log", model_runner._ModelArchiver)):
+      tempDir = tempfile.mkdtemp(dir=parentDir)
+      try:
+        _benchmarkArchiver(archiverName, archiverClass, numModels, numSwaps,
+                           numRows, data, runSec, saveSec, tempDir)
+      finally:
+        shutil.rmtree(tempDir)
+
+
+
+if __name__ == "__main__":
+  main(**_parseArgs())
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Benchmark the reschedule latency of hot models with and without the hand-off
+of model snapshots between model runners: the models are swapped in round
+robin, each for a few input rows, with a new _ModelArchiver per swap like a
+new model_runner process. The reschedule latency of a model is the time to
+checkpoint it when its model runner stops (swap-out) plus the time to load it
+in the next one (swap-in), before it processes its next input row.
+
+The stub model saves a file of --size MB after taking --save-ms to serialize
+itself, takes --load-ms to deserialize itself and --run-ms per input row.
+Prints the median and 95th percentile latencies, the input rows replayed per
+swap-in and the numbers of full checkpoints and attached snapshots.
+
+The archive is created in a temporary directory under --dir, which should be
+on the filesystem of the production archive; the snapshots under
+--handoff-dir.
+"""
+
+import logging
+from optparse import OptionParser
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+from mock import patch
+
+from nupic.frameworks.opf.modelfactory import ModelFactory
+
+from htmengine.model_checkpoint_mgr.model_checkpoint_mgr import (
+  ModelCheckpointMgr)
+from htmengine.model_swapper import model_runner
+from htmengine.model_swapper.model_snapshot_handoff import ModelSnapshotHandoff
+
+
+
+class _StubModelResult(object):
+
+  def __init__(self, inferences):
+    self.inferences = inferences
+
+
+
+class _StubModel(object):
+
+  def __init__(self, data, options):
+    self._data = data
+    self._options = options
+    self.numRows = 0
+
+
+  def run(self, inputRecord):  # pylint: disable=W0613
+    self.numRows += 1
+    time.sleep(self._options["runSec"])
+    return _StubModelResult(inferences={"anomalyScore": 0.0})
+
+
+  def save(self, saveModelDir):
+    time.sleep(self._options["saveSec"])
+    os.mkdir(saveModelDir)
+    with open(os.path.join(saveModelDir, "model.pkl"), "wb") as fileObj:
+      fileObj.write(self._data)
+
+
+
+def _loadStubModel(savedModelDir, options):
+  with open(os.path.join(savedModelDir, "model.pkl"), "rb") as fileObj:
+    data = fileObj.read()
+
+  time.sleep(options["loadSec"])
+  return _StubModel(data, options)
+
+
+
+def _parseArgs():
+  parser = OptionParser(usage="%prog [options]\n\n" + __doc__.strip())
+
+  parser.add_option("--models", type="int", default=5, dest="numModels",
+                    help="Number of models [default: %default]")
+  parser.add_option("--swaps", type="int", default=200, dest="numSwaps",
+                    help="Number of swaps [default: %default]")
+  parser.add_option("--rows-per-swap", type="int", default=10,
+                    dest="rowsPerSwap",
+                    help="Number of input rows per swap [default: %default]")
+  parser.add_option("--size", type="float", default=8, dest="sizeMB",
+                    help="Size of a saved model in MB [default: %default]")
+  parser.add_option("--save-ms", type="float", default=100, dest="saveMs",
+                    help=("Time of the model to serialize itself in ms "
+                          "[default: %default]"))
+  parser.add_option("--load-ms", type="float", default=100, dest="loadMs",
+                    help=("Time of the model to deserialize itself in ms "
+                          "[default: %default]"))
+  parser.add_option("--run-ms", type="float", default=5, dest="runMs",
+                    help=("Time of the model per input row in ms "
+                          "[default: %default]"))
+  parser.add_option("--dir", default=None, dest="parentDir",
+                    help=("Directory in which to create the archive "
+                          "[default: the system's temporary directory]"))
+  parser.add_option("--handoff-dir", default="/dev/shm",
+                    dest="handoffParentDir",
+                    help=("Directory in which to create the hand-off root "
+                          "[default: %default]"))
+
+  options, remainingArgs = parser.parse_args()
+  if remainingArgs:
+    parser.error("Unexpected remaining args: %r" % (remainingArgs,))
+
+  return dict(numModels=options.numModels,
+              numSwaps=options.numSwaps,
+              rowsPerSwap=options.rowsPerSwap,
+              sizeMB=options.sizeMB,
+              stubOptions=dict(saveSec=options.saveMs / 1000.0,
+                               loadSec=options.loadMs / 1000.0,
+                               runSec=options.runMs / 1000.0),
+              parentDir=options.parentDir,
+              handoffParentDir=options.handoffParentDir)
+
+
+
+def _percentile(values, percent):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+
+def _runSwaps(modelIDs, numSwaps, rowsPerSwap):
+  """
+  :returns: dict with the lists of swap-out and swap-in latencies in ms and
+    the numbers of replayed rows, full checkpoints and attached snapshots
+  """
+  stats = dict(saveMsList=[], loadMsList=[], numReplayedRows=0,
+               numFullCheckpoints=0, numAttached=0)
+
+  originalSave = ModelCheckpointMgr.save
+  def countingSave(checkpointMgr, *args, **kwargs):
+    stats["numFullCheckpoints"] += 1
+    return originalSave(checkpointMgr, *args, **kwargs)
+
+  originalAttach = ModelSnapshotHandoff.attach
+  def countingAttach(handoff, *args, **kwargs):
+    model = originalAttach(handoff, *args, **kwargs)
+    stats["numAttached"] += model is not None
+    return model
+
+  # The model runner of each model and the input samples of its run; it stops
+  # when the model is swapped in again
+  runs = dict()
+
+  with patch.object(ModelCheckpointMgr, "save", autospec=True,
+                    side_effect=countingSave), \
+      patch.object(ModelSnapshotHandoff, "attach", autospec=True,
+                   side_effect=countingAttach):
+    for swap in xrange(numSwaps):
+      modelID = modelIDs[swap % len(modelIDs)]
+
+      # Swap-out of the model's previous model runner, if any, and swap-in of
+      # a new one
+      if modelID in runs:
+        archiver, inputSamples = runs.pop(modelID)
+        start = time.time()
+        archiver.saveModel(currentRunBatchIDSet=set([uuid.uuid1().hex]),
+                           currentRunInputSamples=inputSamples)
+        stats["saveMsList"].append((time.time() - start) * 1000.0)
+
+      archiver = model_runner._ModelArchiver(modelID)
+      start = time.time()
+      archiver.modelCheckpointBatchIDSet  # pylint: disable=W0104
+      archiver.loadModel()
+      stats["loadMsList"].append((time.time() - start) * 1000.0)
+      stats["numReplayedRows"] += archiver.model.numRows
+
+      inputSamples = []
+      for i in xrange(rowsPerSwap):
+        inputSample = [float(swap * rowsPerSwap + i)]
+        archiver.inputRowEncoder.appendRecord(inputSample)
+        archiver.model.run(archiver.inputRowEncoder.getNextRecordDict())
+        inputSamples.append(inputSample)
+
+      runs[modelID] = (archiver, inputSamples)
+
+  return stats
+
+
+
+def _benchmarkMode(mode, numModels, numSwaps, rowsPerSwap, data, stubOptions,
+                   tempDir, handoffTempDir):
+  handoffConfig = (None, None)
+  if mode == "handoff":
+    handoffConfig = (os.path.join(handoffTempDir, "handoff"), 300)
+
+  with patch.object(ModelCheckpointMgr, "_getStorageRoot",
+                    return_value=os.path.join(tempDir, "root")), \
+      patch.object(ModelCheckpointMgr, "_getRamTierConfig",
+                   return_value=(None, None, None)), \
+      patch.object(ModelSnapshotHandoff, "_getConfig",
+                   return_value=handoffConfig), \
+      patch.object(ModelFactory, "loadFromCheckpoint",
+                   side_effect=lambda savedModelDir: _loadStubModel(
+                     savedModelDir, stubOptions)):
+    checkpointMgr = ModelCheckpointMgr()
+    modelIDs = [uuid.uuid1().hex for _ in xrange(numModels)]
+    for modelID in modelIDs:
+      checkpointMgr.define(modelID, definition=dict(
+        inputSchema=[("c1", "float", "")]))
+      checkpointMgr.save(modelID, _StubModel(data, stubOptions),
+                         attributes={
+                           model_runner._ModelArchiver.
+                           _BATCH_IDS_CHECKPOINT_ATTR_NAME: []})
+
+    stats = _runSwaps(modelIDs, numSwaps, rowsPerSwap)
+
+  rescheduleMsList = [
+    saveMs + loadMs
+    for saveMs, loadMs in zip(stats["saveMsList"],
+                              stats["loadMsList"][numModels:])]
+
+  print "%-10s %9.1f %9.1f %9.1f %9.1f %9.1f %9.1f %9.1f %6d %8d" % (
+    mode,
+    _percentile(stats["saveMsList"], 50), _percentile(stats["saveMsList"], 95),
+    _percentile(stats["loadMsList"], 50), _percentile(stats["loadMsList"], 95),
+    _percentile(rescheduleMsList, 50), _percentile(rescheduleMsList, 95),
+    stats["numReplayedRows"] / float(numSwaps), stats["numFullCheckpoints"],
+    stats["numAttached"])
+
+
+
+def main(numModels, numSwaps, rowsPerSwap, sizeMB, stubOptions, parentDir,
+         handoffParentDir):
+  logging.disable(logging.CRITICAL)
+
+  data = os.urandom(int(sizeMB * 1024 * 1024))
+
+  print "%-10s %9s %9s %9s %9s %9s %9s %9s %6s %8s" % (
+    "mode", "out-p50", "out-p95", "in-p50", "in-p95", "resch-p50",
+    "resch-p95", "replayed", "full", "attached")
+  for mode in ("checkpoint", "handoff"):
+    tempDir = tempfile.mkdtemp(dir=parentDir)
+    handoffTempDir = tempfile.mkdtemp(dir=handoffParentDir)
+    try:
+      _benchmarkMode(mode, numModels, numSwaps, rowsPerSwap, data, stubOptions,
+                     tempDir, handoffTempDir)
+    finally:
+      shutil.rmtree(tempDir)
+      shutil.rmtree(handoffTempDir)
+
+
+
+if __name__ == "__main__":
+  main(**_parseArgs())
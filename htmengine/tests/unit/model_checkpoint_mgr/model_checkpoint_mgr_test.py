@@ -20,12 +20,22 @@
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
 
+import errno
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
 import uuid
 
 import unittest
 
+from mock import patch
+
 from htmengine.model_checkpoint_mgr.model_checkpoint_mgr import (
-    ModelCheckpointMgr, ModelNotFound, ModelAlreadyExists)
+    ModelCheckpointMgr, ModelNotFound, ModelAlreadyExists, RamTierFlusher,
+    _RetiredTreeReaper)
 from htmengine.model_checkpoint_mgr.model_checkpoint_test_utils import (
     ModelCheckpointStoragePatch)
 from nupic.frameworks.opf.modelfactory import ModelFactory
@@ -464,5 +474,770 @@ class TestModelCheckpointMgr(unittest.TestCase):
 
 
 
+
+class _StubModel(object):
+  """ Stand-in for an OPF model that saves a file """
+
+  def __init__(self, name):
+    self.name = name
+
+
+  def save(self, saveModelDir):
+    os.mkdir(saveModelDir)
+    with open(os.path.join(saveModelDir, "model.txt"), "w") as fileObj:
+      fileObj.write(self.name)
+
+
+
+@ModelCheckpointStoragePatch(kw="storagePatch")
+class TestModelCheckpointMgrLayout(unittest.TestCase):
+
+
+  def _defineModels(self, checkpointMgr, numModels):
+    """ Define models, half of them with checkpoints
+
+    :returns: sorted model IDs
+    """
+    modelIDs = sorted(uuid.uuid1().hex for _ in xrange(numModels))
+    for i, modelID in enumerate(modelIDs):
+      checkpointMgr.define(modelID, definition={"i": i})
+      if i % 2 == 0:
+        checkpointMgr.save(modelID, _StubModel("m%d" % (i,)),
+                           attributes={"i": i})
+
+    return modelIDs
+
+
+  def _assertModelsReadable(self, checkpointMgr, modelIDs):
+    self.assertItemsEqual(checkpointMgr.getModelIDs(), modelIDs)
+    for i, modelID in enumerate(modelIDs):
+      self.assertEqual(checkpointMgr.loadModelDefinition(modelID), {"i": i})
+      if i % 2 == 0:
+        self.assertEqual(checkpointMgr.loadCheckpointAttributes(modelID),
+                         {"i": i})
+        with open(os.path.join(
+            checkpointMgr._getCurrentCheckpointRealPath(modelID),
+            checkpointMgr._CHECKPOINT_INSTANCE_DIR_NAME,
+            "model.txt")) as fileObj:
+          self.assertEqual(fileObj.read(), "m%d" % (i,))
+      else:
+        with self.assertRaises(ModelNotFound):
+          checkpointMgr.loadCheckpointAttributes(modelID)
+
+
+  @staticmethod
+  def _getRootEntries(storagePatch):
+    return sorted(name for name in os.listdir(
+      storagePatch.tempModelCheckpointDir) if not name.startswith("."))
+
+
+  def testHashedLayoutOfNewArchive(self, storagePatch):
+    with patch.object(ModelCheckpointMgr, "_getConfiguredLayoutVersion",
+                      return_value=ModelCheckpointMgr._HASHED_LAYOUT_VERSION):
+      checkpointMgr = ModelCheckpointMgr()
+
+    modelIDs = self._defineModels(checkpointMgr, 6)
+    self._assertModelsReadable(checkpointMgr, modelIDs)
+
+    # Entries are in shard directories
+    for modelID in modelIDs:
+      self.assertEqual(checkpointMgr._getModelDir(modelID, mustExist=True),
+                       checkpointMgr._getHashedModelDir(modelID))
+    self.assertTrue(all(len(name) == 2
+                        for name in self._getRootEntries(storagePatch)))
+
+    # The layout is recorded for instances that aren't configured for it
+    self._assertModelsReadable(ModelCheckpointMgr(), modelIDs)
+
+    checkpointMgr.save(modelIDs[0], _StubModel("new"), attributes="new")
+    self.assertEqual(checkpointMgr.loadCheckpointAttributes(modelIDs[0]),
+                     "new")
+
+    destModelID = uuid.uuid1().hex
+    checkpointMgr.clone(modelIDs[0], destModelID)
+    self.assertEqual(checkpointMgr.loadCheckpointAttributes(destModelID),
+                     "new")
+
+    for modelID in modelIDs:
+      checkpointMgr.remove(modelID)
+    self.assertEqual(checkpointMgr.getModelIDs(), [destModelID])
+
+
+  def testConfiguredHashedLayoutKeepsExistingFlatArchive(self, storagePatch):
+    modelIDs = self._defineModels(ModelCheckpointMgr(), 2)
+
+    with patch.object(ModelCheckpointMgr, "_getConfiguredLayoutVersion",
+                      return_value=ModelCheckpointMgr._HASHED_LAYOUT_VERSION):
+      checkpointMgr = ModelCheckpointMgr()
+
+    self.assertEqual(checkpointMgr._layoutVersion,
+                     ModelCheckpointMgr._FLAT_LAYOUT_VERSION)
+    self._assertModelsReadable(checkpointMgr, modelIDs)
+    self.assertEqual(self._getRootEntries(storagePatch), modelIDs)
+
+
+  def testMigrationToHashedLayout(self, storagePatch):
+    checkpointMgr = ModelCheckpointMgr()
+    modelIDs = self._defineModels(checkpointMgr, 10)
+
+    # Entries saved before relative checkpoint links link to absolute paths
+    modelEntryDirPath = checkpointMgr._getModelDir(modelIDs[0], mustExist=True)
+    linkPath = os.path.join(modelEntryDirPath,
+                            ModelCheckpointMgr._CHECKPOINT_LINK_NAME)
+    absoluteTarget = os.path.join(modelEntryDirPath, os.readlink(linkPath))
+    os.unlink(linkPath)
+    os.symlink(absoluteTarget, linkPath)
+
+    # An instance that still has the flat layout loaded
+    staleCheckpointMgr = ModelCheckpointMgr()
+
+    self.assertEqual(ModelCheckpointMgr().migrateToHashedLayout(), 10)
+
+    self.assertTrue(all(len(name) == 2
+                        for name in self._getRootEntries(storagePatch)))
+    with open(os.path.join(storagePatch.tempModelCheckpointDir,
+                           ModelCheckpointMgr._LAYOUT_FILE_NAME)) as fileObj:
+      self.assertEqual(json.load(fileObj), {"layoutVersion": 2})
+
+    self._assertModelsReadable(staleCheckpointMgr, modelIDs)
+    self._assertModelsReadable(checkpointMgr, modelIDs)
+
+    # New entries are defined per the new layout by the stale instance
+    staleCheckpointMgr = ModelCheckpointMgr()
+    staleCheckpointMgr._layoutVersion = ModelCheckpointMgr._FLAT_LAYOUT_VERSION
+    modelID = uuid.uuid1().hex
+    staleCheckpointMgr.define(modelID, definition={})
+    self.assertEqual(staleCheckpointMgr._getModelDir(modelID, mustExist=True),
+                     staleCheckpointMgr._getHashedModelDir(modelID))
+
+    # Migrating again is a no-op
+    self.assertEqual(checkpointMgr.migrateToHashedLayout(), 0)
+
+
+  def testInterruptedMigrationIsResumed(self, storagePatch):
+    checkpointMgr = ModelCheckpointMgr()
+    modelIDs = self._defineModels(checkpointMgr, 10)
+
+    migrateModelEntry = ModelCheckpointMgr._migrateModelEntry
+    migrations = []
+    def interruptMigration(self, modelID, shardPaths):
+      if len(migrations) == 4:
+        raise KeyboardInterrupt
+      migrations.append(modelID)
+      return migrateModelEntry(self, modelID, shardPaths)
+
+    with patch.object(ModelCheckpointMgr, "_migrateModelEntry",
+                      autospec=True, side_effect=interruptMigration):
+      with self.assertRaises(KeyboardInterrupt):
+        ModelCheckpointMgr().migrateToHashedLayout()
+
+    # Both layouts are in use; all the models are readable and writable
+    self.assertEqual(len(self._getRootEntries(storagePatch)), 10)
+    self._assertModelsReadable(checkpointMgr, modelIDs)
+
+    checkpointMgr.save(modelIDs[1], _StubModel("m1"), attributes={"i": 1})
+    newModelID = uuid.uuid1().hex
+    checkpointMgr.define(newModelID, definition={"i": 10})
+    self.assertEqual(checkpointMgr._getModelDir(newModelID, mustExist=True),
+                     checkpointMgr._getHashedModelDir(newModelID))
+    modelIDs.append(newModelID)
+    self.assertEqual(len(checkpointMgr.getModelIDs()), 11)
+
+    self.assertEqual(ModelCheckpointMgr().migrateToHashedLayout(), 6)
+    self.assertEqual(checkpointMgr._layoutVersion,
+                     ModelCheckpointMgr._FLAT_LAYOUT_VERSION)
+    self.assertItemsEqual(checkpointMgr.getModelIDs(), modelIDs)
+    self.assertEqual(checkpointMgr._layoutVersion,
+                     ModelCheckpointMgr._HASHED_LAYOUT_VERSION)
+
+
+  def testOperationsRetriedWhenModelEntryIsMoved(self, storagePatch):
+    checkpointMgr = ModelCheckpointMgr()
+    modelIDs = self._defineModels(checkpointMgr, 4)
+    checkpointMgr._saveLayout(
+      ModelCheckpointMgr._FLAT_LAYOUT_VERSION,
+      migratingToVersion=ModelCheckpointMgr._HASHED_LAYOUT_VERSION)
+
+    getCheckpointStoreDirPath = ModelCheckpointMgr._getCheckpointStoreDirPath
+    def migrateBeforeFirstCall(self, modelID, modelEntryDirPath):
+      # Move the entry after its path was looked up
+      if os.path.exists(self._getFlatModelDir(modelID)):
+        self._migrateModelEntry(modelID, set())
+      return getCheckpointStoreDirPath(self, modelID, modelEntryDirPath)
+
+    with patch.object(ModelCheckpointMgr, "_getCheckpointStoreDirPath",
+                      autospec=True, side_effect=migrateBeforeFirstCall):
+      self.assertEqual(checkpointMgr.loadCheckpointAttributes(modelIDs[0]),
+                       {"i": 0})
+      checkpointMgr.updateCheckpointAttributes(modelIDs[2], "updated")
+
+    self.assertEqual(checkpointMgr.loadCheckpointAttributes(modelIDs[2]),
+                     "updated")
+
+    # Move the entry while the new checkpoint store is being installed
+    rename = os.rename
+    def migrateAfterStoreIsInstalled(src, dst):
+      rename(src, dst)
+      if os.path.basename(dst).startswith(
+          ModelCheckpointMgr._CHECKPOINT_STORE_DIR_NAME_BASE):
+        checkpointMgr._migrateModelEntry(modelIDs[1], set())
+
+    with patch.object(os, "rename", side_effect=migrateAfterStoreIsInstalled):
+      checkpointMgr.save(modelIDs[1], _StubModel("m1"), attributes={"i": 1})
+
+    self.assertEqual(checkpointMgr.loadCheckpointAttributes(modelIDs[1]),
+                     {"i": 1})
+
+    # The store was installed in the moved entry and no other store is left
+    self.assertItemsEqual(
+      os.listdir(checkpointMgr._getHashedModelDir(modelIDs[1])),
+      [ModelCheckpointMgr._CHECKPOINT_LINK_NAME,
+       ModelCheckpointMgr._MODEL_DEFINITION_FILE_NAME,
+       ModelCheckpointMgr._MODEL_ENTRY_VERSION_FILE_NAME,
+       os.path.basename(
+         checkpointMgr._getCurrentCheckpointRealPath(modelIDs[1]))])
+
+
+  def testUnsupportedLayoutIsRejected(self, storagePatch):
+    with open(os.path.join(storagePatch.tempModelCheckpointDir,
+                           ModelCheckpointMgr._LAYOUT_FILE_NAME),
+              "w") as fileObj:
+      json.dump({"layoutVersion": 3}, fileObj)
+
+    with self.assertRaises(ValueError):
+      ModelCheckpointMgr()
+
+
+
+@ModelCheckpointStoragePatch()
+class TestModelCheckpointMgrCloneAndRetirement(unittest.TestCase):
+
+
+  def _getCheckpointStoreDirNames(self, checkpointMgr, modelID):
+    modelEntryDirPath = checkpointMgr._getModelDir(modelID, mustExist=True)
+    return [
+      name for name in os.listdir(modelEntryDirPath)
+      if name.startswith(ModelCheckpointMgr._CHECKPOINT_STORE_DIR_NAME_BASE)]
+
+
+  def _readModel(self, checkpointMgr, modelID):
+    with open(os.path.join(checkpointMgr._getCurrentCheckpointRealPath(modelID),
+                           ModelCheckpointMgr._CHECKPOINT_INSTANCE_DIR_NAME,
+                           "model.txt")) as fileObj:
+      return fileObj.read()
+
+
+  def _waitUntilReaped(self, checkpointMgr):
+    """ Wait for the background reaper to empty the retired directory """
+    deadline = time.time() + 10
+    while os.listdir(checkpointMgr._retiredDir):
+      self.assertLess(time.time(), deadline, "Retired trees weren't reaped")
+      time.sleep(0.01)
+
+
+  def testCloneSharesFiles(self):
+    checkpointMgr = ModelCheckpointMgr()
+    modelID = uuid.uuid1().hex
+    checkpointMgr.define(modelID, definition={"a": 1})
+    checkpointMgr.save(modelID, _StubModel("m1"), attributes="attrs")
+
+    # A store that was left behind by a crash isn't cloned
+    os.mkdir(os.path.join(checkpointMgr._getModelDir(modelID, mustExist=True),
+                          ModelCheckpointMgr._CHECKPOINT_STORE_DIR_NAME_BASE +
+                          "0.000000"))
+
+    destModelID = uuid.uuid1().hex
+    checkpointMgr.clone(modelID, destModelID)
+
+    self.assertEqual(len(self._getCheckpointStoreDirNames(checkpointMgr,
+                                                          destModelID)), 1)
+    for relPath in (
+        ModelCheckpointMgr._MODEL_DEFINITION_FILE_NAME,
+        os.path.join(ModelCheckpointMgr._CHECKPOINT_LINK_NAME,
+                     ModelCheckpointMgr._CHECKPOINT_INSTANCE_DIR_NAME,
+                     "model.txt")):
+      self.assertEqual(
+        os.stat(os.path.join(checkpointMgr._getModelDir(modelID, True),
+                             relPath)).st_ino,
+        os.stat(os.path.join(checkpointMgr._getModelDir(destModelID, True),
+                             relPath)).st_ino)
+
+    # Changes to the source don't affect the clone
+    checkpointMgr.updateCheckpointAttributes(modelID, "updated")
+    checkpointMgr.save(modelID, _StubModel("m2"), attributes="new")
+    checkpointMgr.remove(modelID)
+    self._waitUntilReaped(checkpointMgr)
+
+    self.assertEqual(checkpointMgr.loadModelDefinition(destModelID), {"a": 1})
+    self.assertEqual(checkpointMgr.loadCheckpointAttributes(destModelID),
+                     "attrs")
+    self.assertEqual(self._readModel(checkpointMgr, destModelID), "m1")
+
+
+  def testCloneFallsBackToCopying(self):
+    checkpointMgr = ModelCheckpointMgr()
+    modelID = uuid.uuid1().hex
+    checkpointMgr.define(modelID, definition={"a": 1})
+    checkpointMgr.save(modelID, _StubModel("m1"), attributes="attrs")
+
+    destModelID = uuid.uuid1().hex
+    with patch.object(os, "link", autospec=True,
+                      side_effect=OSError(errno.EPERM, "Not permitted")), \
+        patch("fcntl.ioctl", autospec=True,
+              side_effect=IOError(errno.EOPNOTSUPP, "Not supported")) as ioctl:
+      checkpointMgr.clone(modelID, destModelID)
+
+    self.assertFalse(checkpointMgr._canHardLink)
+    self.assertFalse(checkpointMgr._canReflink)
+    self.assertLessEqual(ioctl.call_count, 1)
+
+    definitionFilePaths = [
+      os.path.join(checkpointMgr._getModelDir(x, mustExist=True),
+                   ModelCheckpointMgr._MODEL_DEFINITION_FILE_NAME)
+      for x in (modelID, destModelID)]
+    self.assertNotEqual(os.stat(definitionFilePaths[0]).st_ino,
+                        os.stat(definitionFilePaths[1]).st_ino)
+
+    self.assertEqual(checkpointMgr.loadModelDefinition(destModelID), {"a": 1})
+    self.assertEqual(checkpointMgr.loadCheckpointAttributes(destModelID),
+                     "attrs")
+    self.assertEqual(self._readModel(checkpointMgr, destModelID), "m1")
+
+
+  def testOldCheckpointStoresAreReapedInBackground(self):
+    checkpointMgr = ModelCheckpointMgr()
+    modelID = uuid.uuid1().hex
+    checkpointMgr.define(modelID, definition={"a": 1})
+
+    with patch.object(_RetiredTreeReaper, "notify", autospec=True):
+      for i in xrange(3):
+        checkpointMgr.save(modelID, _StubModel("m%d" % (i,)), attributes=i)
+
+      self.assertEqual(len(self._getCheckpointStoreDirNames(checkpointMgr,
+                                                            modelID)), 1)
+      self.assertEqual(len(os.listdir(checkpointMgr._retiredDir)), 2)
+
+      checkpointMgr.remove(modelID)
+      self.assertEqual(checkpointMgr.getModelIDs(), [])
+      self.assertEqual(_RetiredTreeReaper.reap(checkpointMgr._retiredDir), 3)
+
+    self.assertEqual(os.listdir(checkpointMgr._retiredDir), [])
+
+
+  def testCrashBeforeCheckpointIsInstalled(self):
+    checkpointMgr = ModelCheckpointMgr()
+    modelID = uuid.uuid1().hex
+    checkpointMgr.define(modelID, definition={"a": 1})
+    checkpointMgr.save(modelID, _StubModel("m1"), attributes="old")
+
+    # Crash after the new store was moved into the entry, before the link to
+    # it replaced the current one
+    rename = os.rename
+    def crashOnLinkRename(src, dst):
+      if os.path.basename(dst) == ModelCheckpointMgr._CHECKPOINT_LINK_NAME:
+        raise OSError(errno.EIO, "Simulated crash")
+      rename(src, dst)
+
+    with patch.object(os, "rename", side_effect=crashOnLinkRename):
+      with self.assertRaises(OSError):
+        checkpointMgr.save(modelID, _StubModel("m2"), attributes="new")
+
+    # The old checkpoint remains current after the restart
+    checkpointMgr = ModelCheckpointMgr()
+    self.assertEqual(checkpointMgr.loadCheckpointAttributes(modelID), "old")
+    self.assertEqual(self._readModel(checkpointMgr, modelID), "m1")
+    self.assertEqual(len(self._getCheckpointStoreDirNames(checkpointMgr,
+                                                          modelID)), 2)
+
+    # The orphaned store is retired by the next save
+    checkpointMgr.save(modelID, _StubModel("m3"), attributes="newer")
+    self.assertEqual(checkpointMgr.loadCheckpointAttributes(modelID), "newer")
+    self.assertEqual(len(self._getCheckpointStoreDirNames(checkpointMgr,
+                                                          modelID)), 1)
+    self._waitUntilReaped(checkpointMgr)
+
+
+  def testCrashBeforeOldCheckpointIsRetired(self):
+    checkpointMgr = ModelCheckpointMgr()
+    modelID = uuid.uuid1().hex
+    checkpointMgr.define(modelID, definition={"a": 1})
+    checkpointMgr.save(modelID, _StubModel("m1"), attributes="old")
+
+    with patch.object(ModelCheckpointMgr, "_retireStaleCheckpointStores",
+                      autospec=True,
+                      side_effect=OSError(errno.EIO, "Simulated crash")):
+      with self.assertRaises(OSError):
+        checkpointMgr.save(modelID, _StubModel("m2"), attributes="new")
+
+    # The new checkpoint is current after the restart
+    checkpointMgr = ModelCheckpointMgr()
+    self.assertEqual(checkpointMgr.loadCheckpointAttributes(modelID), "new")
+    self.assertEqual(self._readModel(checkpointMgr, modelID), "m2")
+    self.assertEqual(len(self._getCheckpointStoreDirNames(checkpointMgr,
+                                                          modelID)), 2)
+
+    checkpointMgr.save(modelID, _StubModel("m3"), attributes="newer")
+    self.assertEqual(len(self._getCheckpointStoreDirNames(checkpointMgr,
+                                                          modelID)), 1)
+    self._waitUntilReaped(checkpointMgr)
+
+
+  def testRetiredTreesAreReapedAfterRestart(self):
+    checkpointMgr = ModelCheckpointMgr()
+    modelIDs = [uuid.uuid1().hex for _ in xrange(2)]
+    for modelID in modelIDs:
+      checkpointMgr.define(modelID, definition={"a": 1})
+      checkpointMgr.save(modelID, _StubModel("m1"), attributes="old")
+
+    # Crash before the retired trees are deleted: one of them is partially
+    # deleted
+    with patch.object(_RetiredTreeReaper, "notify", autospec=True):
+      checkpointMgr.save(modelIDs[0], _StubModel("m2"), attributes="new")
+      checkpointMgr.remove(modelIDs[1])
+
+    retiredPaths = [os.path.join(checkpointMgr._retiredDir, name)
+                    for name in os.listdir(checkpointMgr._retiredDir)]
+    self.assertEqual(len(retiredPaths), 2)
+    for dirPath, _dirNames, fileNames in os.walk(retiredPaths[0]):
+      for fileName in fileNames[:1]:
+        os.unlink(os.path.join(dirPath, fileName))
+
+    # The removed model is gone and may be defined again
+    self.assertEqual(checkpointMgr.getModelIDs(), [modelIDs[0]])
+    with self.assertRaises(ModelNotFound):
+      checkpointMgr.loadModelDefinition(modelIDs[1])
+    checkpointMgr.define(modelIDs[1], definition={"b": 2})
+
+    # The retired trees are deleted in the background after the restart
+    checkpointMgr = ModelCheckpointMgr()
+    self._waitUntilReaped(checkpointMgr)
+
+    self.assertEqual(checkpointMgr.loadCheckpointAttributes(modelIDs[0]),
+                     "new")
+    self.assertEqual(checkpointMgr.loadModelDefinition(modelIDs[1]), {"b": 2})
+
+
+
+@ModelCheckpointStoragePatch()
+class TestModelCheckpointMgrInputLog(unittest.TestCase):
+
+
+  def _defineModel(self, checkpointMgr):
+    modelID = uuid.uuid1().hex
+    checkpointMgr.define(modelID, definition={"a": 1})
+    return modelID
+
+
+  def _getLogFilePath(self, checkpointMgr, modelID):
+    return (checkpointMgr._getCurrentCheckpointRealPath(modelID) +
+            ModelCheckpointMgr._CHECKPOINT_LOG_FILE_NAME_SUFFIX)
+
+
+  def testAppendAndLoadCheckpointLog(self):
+    checkpointMgr = ModelCheckpointMgr()
+    modelID = self._defineModel(checkpointMgr)
+
+    with self.assertRaises(ModelNotFound):
+      checkpointMgr.appendCheckpointLog(modelID, "r1")
+
+    checkpointMgr.save(modelID, _StubModel("m1"), attributes="a1")
+    self.assertEqual(checkpointMgr.loadCheckpointLog(modelID), [])
+
+    checkpointMgr.appendCheckpointLog(modelID, "r1")
+    checkpointMgr.appendCheckpointLog(modelID, "")
+    checkpointMgr.appendCheckpointLog(modelID, "r3" * 1000)
+
+    self.assertEqual(ModelCheckpointMgr().loadCheckpointLog(modelID),
+                     ["r1", "", "r3" * 1000])
+
+    # A new checkpoint starts with an empty log; the old one is retired
+    oldLogFilePath = self._getLogFilePath(checkpointMgr, modelID)
+    checkpointMgr.save(modelID, _StubModel("m2"), attributes="a2")
+    self.assertFalse(os.path.exists(oldLogFilePath))
+    self.assertEqual(checkpointMgr.loadCheckpointLog(modelID), [])
+
+    checkpointMgr.appendCheckpointLog(modelID, "r4")
+    self.assertEqual(checkpointMgr.loadCheckpointLog(modelID), ["r4"])
+
+    checkpointMgr.remove(modelID)
+    with self.assertRaises(ModelNotFound):
+      checkpointMgr.loadCheckpointLog(modelID)
+
+
+  def testTornRecordIsDiscarded(self):
+    checkpointMgr = ModelCheckpointMgr()
+    modelID = self._defineModel(checkpointMgr)
+    checkpointMgr.save(modelID, _StubModel("m1"), attributes="a1")
+    checkpointMgr.appendCheckpointLog(modelID, "r1")
+    checkpointMgr.appendCheckpointLog(modelID, "r2")
+
+    logFilePath = self._getLogFilePath(checkpointMgr, modelID)
+    with open(logFilePath, "rb") as fileObj:
+      data = fileObj.read()
+
+    # A crash while appending the second record: truncated or garbled
+    recordSize = len(data) / 2
+    for tornData in (data[:-1],
+                     data[:recordSize + 3],
+                     data[:-1] + chr(ord(data[-1]) ^ 1)):
+      with open(logFilePath, "wb") as fileObj:
+        fileObj.write(tornData)
+
+      checkpointMgr = ModelCheckpointMgr()
+      self.assertEqual(checkpointMgr.loadCheckpointLog(modelID), ["r1"])
+
+      # The torn record is overwritten by the next one
+      ModelCheckpointMgr().appendCheckpointLog(modelID, "r3")
+      self.assertEqual(checkpointMgr.loadCheckpointLog(modelID), ["r1", "r3"])
+      self.assertEqual(os.path.getsize(logFilePath), len(data))
+
+
+  def testCloneCopiesCheckpointLog(self):
+    checkpointMgr = ModelCheckpointMgr()
+    modelID = self._defineModel(checkpointMgr)
+    checkpointMgr.save(modelID, _StubModel("m1"), attributes="a1")
+    checkpointMgr.appendCheckpointLog(modelID, "r1")
+
+    destModelID = uuid.uuid1().hex
+    checkpointMgr.clone(modelID, destModelID)
+
+    self.assertNotEqual(
+      os.stat(self._getLogFilePath(checkpointMgr, modelID)).st_ino,
+      os.stat(self._getLogFilePath(checkpointMgr, destModelID)).st_ino)
+
+    # Appending to the source doesn't affect the clone
+    checkpointMgr.appendCheckpointLog(modelID, "r2")
+    self.assertEqual(checkpointMgr.loadCheckpointLog(destModelID), ["r1"])
+    checkpointMgr.appendCheckpointLog(destModelID, "d2")
+    self.assertEqual(checkpointMgr.loadCheckpointLog(modelID), ["r1", "r2"])
+    self.assertEqual(checkpointMgr.loadCheckpointLog(destModelID),
+                     ["r1", "d2"])
+
+
+
+@ModelCheckpointStoragePatch(kw="storagePatch")
+class TestModelCheckpointMgrRamTier(unittest.TestCase):
+
+
+  def setUp(self):
+    self.ramRoot = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.ramRoot)
+
+    self.ramTierConfig = (self.ramRoot, 30, 1000)
+    patcher = patch.object(ModelCheckpointMgr, "_getRamTierConfig",
+                           autospec=True,
+                           side_effect=lambda: self.ramTierConfig)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+    patcher = patch.object(
+      ModelFactory, "loadFromCheckpoint", autospec=True,
+      side_effect=lambda path: open(os.path.join(path, "model.txt")).read())
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+
+  @staticmethod
+  def _createArchiveOnlyCheckpointMgr():
+    """ Create a ModelCheckpointMgr without the RAM tier, which sees only the
+    archive
+    """
+    with patch.object(ModelCheckpointMgr, "_getRamTierConfig",
+                      return_value=(None, None, None)):
+      return ModelCheckpointMgr()
+
+
+  def _getDirtyModelIDs(self):
+    return os.listdir(os.path.join(self.ramRoot,
+                                   ModelCheckpointMgr._RAM_TIER_DIRTY_DIR_NAME))
+
+
+  def _getRamTierModelIDs(self):
+    return [name for name in os.listdir(self.ramRoot)
+            if not name.startswith(".")]
+
+
+  def _defineModels(self, checkpointMgr, numModels):
+    modelIDs = [uuid.uuid1().hex for _ in xrange(numModels)]
+    for modelID in modelIDs:
+      checkpointMgr.define(modelID, definition={"a": 1})
+    return modelIDs
+
+
+  def testCheckpointsAreSavedToRamTierAndPersisted(self, storagePatch):
+    checkpointMgr = ModelCheckpointMgr()
+    archiveCheckpointMgr = self._createArchiveOnlyCheckpointMgr()
+    modelID = self._defineModels(checkpointMgr, 1)[0]
+
+    checkpointMgr.save(modelID, _StubModel("m1"), attributes="a1")
+
+    self.assertEqual(self._getDirtyModelIDs(), [modelID])
+    self.assertEqual(checkpointMgr.load(modelID), "m1")
+    self.assertEqual(checkpointMgr.loadCheckpointAttributes(modelID), "a1")
+    with self.assertRaises(ModelNotFound):
+      archiveCheckpointMgr.load(modelID)
+
+    self.assertEqual(checkpointMgr.flushRamTier(), 1)
+    self.assertEqual(self._getDirtyModelIDs(), [])
+    self.assertEqual(archiveCheckpointMgr.load(modelID), "m1")
+    self.assertEqual(archiveCheckpointMgr.loadCheckpointAttributes(modelID),
+                     "a1")
+
+    # The persisted checkpoint stays in the RAM tier, where attribute updates
+    # go until they are persisted
+    self.assertEqual(self._getRamTierModelIDs(), [modelID])
+    checkpointMgr.updateCheckpointAttributes(modelID, "a2")
+    self.assertEqual(checkpointMgr.loadCheckpointAttributes(modelID), "a2")
+    self.assertEqual(archiveCheckpointMgr.loadCheckpointAttributes(modelID),
+                     "a1")
+
+    self.assertEqual(checkpointMgr.flushRamTier(), 1)
+    self.assertEqual(archiveCheckpointMgr.loadCheckpointAttributes(modelID),
+                     "a2")
+    self.assertEqual(checkpointMgr.flushRamTier(), 0)
+
+
+  def testCheckpointsBypassRamTierWhenPersistenceIsBehind(self, storagePatch):
+    checkpointMgr = ModelCheckpointMgr()
+    archiveCheckpointMgr = self._createArchiveOnlyCheckpointMgr()
+    modelIDs = self._defineModels(checkpointMgr, 2)
+
+    checkpointMgr.save(modelIDs[0], _StubModel("m1"), attributes="a1")
+    checkpointMgr.save(modelIDs[1], _StubModel("m1"), attributes="a1")
+
+    # Unpersisted for longer than the durability window
+    dirtySinceTime = time.time() - 31
+    os.utime(os.path.join(self.ramRoot,
+                          ModelCheckpointMgr._RAM_TIER_DIRTY_DIR_NAME,
+                          modelIDs[0]),
+             (dirtySinceTime, dirtySinceTime))
+
+    checkpointMgr.save(modelIDs[1], _StubModel("m2"), attributes="a2")
+
+    self.assertEqual(archiveCheckpointMgr.load(modelIDs[1]), "m2")
+    self.assertEqual(checkpointMgr.load(modelIDs[1]), "m2")
+    self.assertEqual(self._getRamTierModelIDs(), [modelIDs[0]])
+
+    self.assertEqual(checkpointMgr.flushRamTier(), 1)
+    checkpointMgr.save(modelIDs[1], _StubModel("m3"), attributes="a3")
+    self.assertEqual(self._getDirtyModelIDs(), [modelIDs[1]])
+
+
+  def testTiersAreReconciledAfterRestart(self, storagePatch):
+    checkpointMgr = ModelCheckpointMgr()
+    archiveCheckpointMgr = self._createArchiveOnlyCheckpointMgr()
+    modelIDs = self._defineModels(checkpointMgr, 4)
+    for modelID in modelIDs:
+      archiveCheckpointMgr.save(modelID, _StubModel("m1"), attributes="a1")
+      checkpointMgr.save(modelID, _StubModel("m2"), attributes="a2")
+
+    # Model 1 was removed and model 2 saved to the archive directly without
+    # the RAM tier's entries being updated; model 3 crashed after it was
+    # marked dirty, before the new checkpoint was installed
+    archiveCheckpointMgr.remove(modelIDs[1])
+    archiveCheckpointMgr.save(modelIDs[2], _StubModel("m3"), attributes="a3")
+    shutil.rmtree(os.path.join(self.ramRoot, modelIDs[3]))
+
+    # Restart
+    checkpointMgr = ModelCheckpointMgr()
+    self.assertEqual(checkpointMgr.load(modelIDs[2]), "m3")
+    self.assertEqual(checkpointMgr.load(modelIDs[3]), "m1")
+
+    self.assertEqual(checkpointMgr.flushRamTier(), 1)
+    self.assertEqual(self._getDirtyModelIDs(), [])
+    self.assertEqual(self._getRamTierModelIDs(), [modelIDs[0]])
+
+    self.assertEqual(archiveCheckpointMgr.load(modelIDs[0]), "m2")
+    self.assertEqual(archiveCheckpointMgr.load(modelIDs[2]), "m3")
+    self.assertEqual(archiveCheckpointMgr.load(modelIDs[3]), "m1")
+    with self.assertRaises(ModelNotFound):
+      checkpointMgr.load(modelIDs[1])
+
+
+  def testLeastRecentlySavedCheckpointsAreEvicted(self, storagePatch):
+    self.ramTierConfig = (self.ramRoot, 30, 2)
+    checkpointMgr = ModelCheckpointMgr()
+    modelIDs = self._defineModels(checkpointMgr, 3)
+    for i, modelID in enumerate(modelIDs):
+      checkpointMgr.save(modelID, _StubModel("m%d" % (i,)), attributes=i)
+
+    # Dirty checkpoints aren't evicted
+    checkpointMgr._evictRamTierEntries()
+    self.assertEqual(len(self._getRamTierModelIDs()), 3)
+
+    self.assertEqual(checkpointMgr.flushRamTier(), 3)
+    self.assertItemsEqual(self._getRamTierModelIDs(), modelIDs[1:])
+
+    for i, modelID in enumerate(modelIDs):
+      self.assertEqual(checkpointMgr.load(modelID), "m%d" % (i,))
+
+
+  def testCloneAndRemoveWithRamTier(self, storagePatch):
+    checkpointMgr = ModelCheckpointMgr()
+    modelID = self._defineModels(checkpointMgr, 1)[0]
+    checkpointMgr.save(modelID, _StubModel("m1"), attributes="a1")
+
+    destModelID = uuid.uuid1().hex
+    checkpointMgr.clone(modelID, destModelID)
+    self.assertEqual(self._getDirtyModelIDs(), [])
+    self.assertEqual(
+      self._createArchiveOnlyCheckpointMgr().load(destModelID), "m1")
+
+    checkpointMgr.save(modelID, _StubModel("m2"), attributes="a2")
+    checkpointMgr.remove(modelID)
+    self.assertEqual(self._getDirtyModelIDs(), [])
+    self.assertEqual(self._getRamTierModelIDs(), [])
+    with self.assertRaises(ModelNotFound):
+      checkpointMgr.load(modelID)
+
+
+  def testRamTierFlusher(self, storagePatch):
+    checkpointMgr = ModelCheckpointMgr()
+    modelIDs = self._defineModels(checkpointMgr, 2)
+    checkpointMgr.save(modelIDs[0], _StubModel("m1"), attributes="a1")
+
+    flusher = RamTierFlusher()
+    flusherThread = threading.Thread(target=flusher.run)
+    flusherThread.start()
+    try:
+      deadline = time.time() + 10
+      while self._getDirtyModelIDs():
+        self.assertLess(time.time(), deadline)
+        time.sleep(0.01)
+
+      checkpointMgr.save(modelIDs[1], _StubModel("m1"), attributes="a1")
+    finally:
+      flusher.requestStopTS()
+      flusherThread.join(10)
+
+    self.assertFalse(flusherThread.isAlive())
+
+    # The last pass persisted the last checkpoint
+    self.assertEqual(self._getDirtyModelIDs(), [])
+    self.assertEqual(
+      self._createArchiveOnlyCheckpointMgr().load(modelIDs[1]), "m1")
+
+
+
+  def testCheckpointLogOfRamTierCheckpoint(self, storagePatch):
+    checkpointMgr = ModelCheckpointMgr()
+    archiveCheckpointMgr = self._createArchiveOnlyCheckpointMgr()
+    modelID = self._defineModels(checkpointMgr, 1)[0]
+    archiveCheckpointMgr.save(modelID, _StubModel("m1"), attributes="a1")
+    archiveCheckpointMgr.appendCheckpointLog(modelID, "r1")
+
+    # The log of the RAM tier's checkpoint is in the archive already
+    checkpointMgr.save(modelID, _StubModel("m2"), attributes="a2")
+    self.assertEqual(checkpointMgr.loadCheckpointLog(modelID), [])
+    checkpointMgr.appendCheckpointLog(modelID, "r2")
+    self.assertEqual(archiveCheckpointMgr.loadCheckpointLog(modelID), ["r1"])
+
+    # ... and stays with the checkpoint when it's persisted
+    self.assertEqual(checkpointMgr.flushRamTier(), 1)
+    self.assertEqual(archiveCheckpointMgr.loadCheckpointLog(modelID), ["r2"])
+    self.assertEqual(checkpointMgr.loadCheckpointLog(modelID), ["r2"])
+
+
+
 if __name__ == '__main__':
   unittest.main()
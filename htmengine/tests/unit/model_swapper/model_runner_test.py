@@ -34,7 +34,7 @@ import threading
 import unittest
 
 
-from mock import Mock, patch
+from mock import ANY, Mock, patch
 
 
 from nupic.data.fieldmeta import FieldMetaInfo
@@ -701,10 +701,14 @@ class TestModelRunner(unittest.TestCase):
     # Verify expected saving of model
     self.assertEqual(
       checkpointMgrInstanceMock.updateCheckpointAttributes.call_count, 0)
+    self._assertLogRecordAppended(checkpointMgrInstanceMock, modelID,
+                                  [requests[0].batchID], [])
 
     expectedCheckpointAttributes = {
       model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME:
-        [requests[0].batchID]
+        [requests[0].batchID],
+      model_runner._ModelArchiver._CHECKPOINT_STATS_ATTR_NAME: ANY,
+      model_runner._ModelArchiver._CHECKPOINT_ID_ATTR_NAME: ANY
       }
     checkpointMgrInstanceMock.save.assert_called_once_with(
       modelID=modelID,
@@ -786,18 +790,13 @@ class TestModelRunner(unittest.TestCase):
 
     # Verify expected saving of model
     self.assertEqual(checkpointMgrInstanceMock.save.call_count, 0)
+    self.assertEqual(
+      checkpointMgrInstanceMock.updateCheckpointAttributes.call_count, 0)
 
-    expectedCheckpointAttributes = {
-      model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME:
-        [requests[0].batchID],
-      model_runner._ModelArchiver._INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME:
-        base64.standard_b64encode(cPickle.dumps(
-          [row.data for row in requests[0].objects],
-          cPickle.HIGHEST_PROTOCOL
-        ))
-      }
-    checkpointMgrInstanceMock.updateCheckpointAttributes. \
-      assert_called_once_with(modelID, expectedCheckpointAttributes)
+    self._assertLogRecordAppended(
+      checkpointMgrInstanceMock, modelID,
+      batchIDs=[requests[0].batchID],
+      inputSamples=[row.data for row in requests[0].objects])
 
     # Verify number of samples passed to model
     self.assertEqual(modelInstanceMock.run.call_count, 2)
@@ -886,10 +885,14 @@ class TestModelRunner(unittest.TestCase):
     # Verify expected saving of model
     self.assertEqual(
       checkpointMgrInstanceMock.updateCheckpointAttributes.call_count, 0)
+    self._assertLogRecordAppended(checkpointMgrInstanceMock, modelID,
+                                  [requests[0].batchID], [])
 
     expectedCheckpointAttributes = {
       model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME:
-        [requests[0].batchID]
+        [requests[0].batchID],
+      model_runner._ModelArchiver._CHECKPOINT_STATS_ATTR_NAME: ANY,
+      model_runner._ModelArchiver._CHECKPOINT_ID_ATTR_NAME: ANY
       }
     checkpointMgrInstanceMock.save.assert_called_once_with(
       modelID=modelID,
@@ -949,14 +952,13 @@ class TestModelRunner(unittest.TestCase):
       return_value = (
         {
           model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME:
-            ["1", "2", "3"],
-          model_runner._ModelArchiver._INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME:
-            base64.standard_b64encode(cPickle.dumps(
-              [data for data in initialIncrementalSamples],
-              cPickle.HIGHEST_PROTOCOL
-            ))
+            ["1", "2", "3"]
         }
       )
+    checkpointMgrInstanceMock.loadCheckpointLog.return_value = [
+      self._encodeLogRecord(["4"], initialIncrementalSamples[:1]),
+      self._encodeLogRecord(["5"], initialIncrementalSamples[1:])
+    ]
     checkpointMgrInstanceMock.loadModelDefinition.return_value = (
       dict(inputSchema=inputRecordSchema))
     checkpointMgrInstanceMock.load.return_value = modelInstanceMock
@@ -996,18 +998,14 @@ class TestModelRunner(unittest.TestCase):
 
     # Verify expected saving of model
     self.assertEqual(checkpointMgrInstanceMock.save.call_count, 0)
+    self.assertEqual(
+      checkpointMgrInstanceMock.updateCheckpointAttributes.call_count, 0)
 
-    expectedCheckpointAttributes = {
-      model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME:
-        [requests[0].batchID],
-      model_runner._ModelArchiver._INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME:
-        base64.standard_b64encode(cPickle.dumps(
-          initialIncrementalSamples + [row.data for row in requests[0].objects],
-          cPickle.HIGHEST_PROTOCOL
-        ))
-      }
-    checkpointMgrInstanceMock.updateCheckpointAttributes. \
-      assert_called_once_with(modelID, expectedCheckpointAttributes)
+    # Only the input samples of this run are appended
+    self._assertLogRecordAppended(
+      checkpointMgrInstanceMock, modelID,
+      batchIDs=[requests[0].batchID],
+      inputSamples=[row.data for row in requests[0].objects])
 
     # Verify number of samples passed to model
     self.assertEqual(modelInstanceMock.run.call_count,
@@ -1058,14 +1056,13 @@ class TestModelRunner(unittest.TestCase):
       return_value = (
         {
           model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME:
-            ["1", "2", "3"],
-          model_runner._ModelArchiver._INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME:
-            base64.standard_b64encode(cPickle.dumps(
-              [data for data in initialIncrementalSamples],
-              cPickle.HIGHEST_PROTOCOL
-            ))
+            ["1", "2", "3"]
         }
       )
+    checkpointMgrInstanceMock.loadCheckpointLog.return_value = [
+      self._encodeLogRecord(["4"], initialIncrementalSamples[:1]),
+      self._encodeLogRecord(["5"], initialIncrementalSamples[1:])
+    ]
     checkpointMgrInstanceMock.loadModelDefinition.return_value = (
       dict(inputSchema=inputRecordSchema))
     checkpointMgrInstanceMock.load.return_value = modelInstanceMock
@@ -1109,10 +1106,14 @@ class TestModelRunner(unittest.TestCase):
     # Verify expected saving of model
     self.assertEqual(
       checkpointMgrInstanceMock.updateCheckpointAttributes.call_count, 0)
+    self._assertLogRecordAppended(checkpointMgrInstanceMock, modelID,
+                                  [requests[0].batchID], [])
 
     expectedCheckpointAttributes = {
       model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME:
-        [requests[0].batchID]
+        [requests[0].batchID],
+      model_runner._ModelArchiver._CHECKPOINT_STATS_ATTR_NAME: ANY,
+      model_runner._ModelArchiver._CHECKPOINT_ID_ATTR_NAME: ANY
       }
     checkpointMgrInstanceMock.save.assert_called_once_with(
       modelID=modelID,
@@ -1135,6 +1136,261 @@ class TestModelRunner(unittest.TestCase):
       modelID=modelID, results=expectedResults)
 
 
+  def _assertLogRecordAppended(self, checkpointMgrInstanceMock, modelID,
+                               batchIDs, inputSamples):
+    """ Check that one record with the given batch IDs and input samples was
+    appended to the input log
+
+    :returns: the decoded record
+    """
+    self.assertEqual(checkpointMgrInstanceMock.appendCheckpointLog.call_count,
+                     1)
+    ((logModelID, record), _kwargs) = (
+      checkpointMgrInstanceMock.appendCheckpointLog.call_args)
+    self.assertEqual(logModelID, modelID)
+
+    logRecord = model_runner._ModelArchiver._decodeLogRecord(record)
+    self.assertEqual(
+      logRecord[model_runner._ModelArchiver._LOG_BATCH_IDS_KEY], batchIDs)
+    self.assertEqual(
+      logRecord[model_runner._ModelArchiver._LOG_INPUT_SAMPLES_KEY],
+      inputSamples)
+
+    return logRecord
+
+
+  @staticmethod
+  def _encodeLogRecord(batchIDs, inputSamples, replaySec=0.0,
+                       replaySecPerSample=None, fullCheckpointSec=None,
+                       snapshotSec=None, checkpointID=None):
+    return model_runner._ModelArchiver._encodeLogRecord({
+      model_runner._ModelArchiver._LOG_BATCH_IDS_KEY: batchIDs,
+      model_runner._ModelArchiver._LOG_INPUT_SAMPLES_KEY: inputSamples,
+      model_runner._ModelArchiver._LOG_REPLAY_SEC_KEY: replaySec,
+      model_runner._ModelArchiver._LOG_CHECKPOINT_STATS_KEY: {
+        model_runner._ModelArchiver._FULL_CHECKPOINT_SEC_STAT_NAME:
+          fullCheckpointSec,
+        model_runner._ModelArchiver._REPLAY_SEC_PER_SAMPLE_STAT_NAME:
+          replaySecPerSample,
+        model_runner._ModelArchiver._SNAPSHOT_SEC_STAT_NAME: snapshotSec
+      },
+      model_runner._ModelArchiver._LOG_CHECKPOINT_ID_KEY: checkpointID
+    })
+
+
+  def _runIncrementalCheckpointModel(self, modelCheckpointMgrClassMock,
+                                     modelSwapperInterfaceClassMock,
+                                     checkpointAttributes, logRecords,
+                                     numInputRows, snapshotHandoffClassMock=None,
+                                     attachSnapshot=False):
+    """ Run a ModelRunner over a batch of input rows with a model that's loaded
+    from a checkpoint with the given attributes and input log, or attached
+    from a snapshot if attachSnapshot is True
+
+    :returns: (checkpointMgrInstanceMock, modelInstanceMock, requests)
+    """
+    modelID = "abc"
+
+    modelInstanceMock = Mock(
+      run=Mock(return_value=Mock(inferences=dict(anomalyScore=1.0))))
+
+    checkpointMgrInstanceMock = modelCheckpointMgrClassMock.return_value
+    checkpointMgrInstanceMock.loadCheckpointAttributes.return_value = (
+      checkpointAttributes)
+    checkpointMgrInstanceMock.loadCheckpointLog.return_value = logRecords
+    checkpointMgrInstanceMock.loadModelDefinition.return_value = (
+      dict(inputSchema=[FieldMetaInfo("c1", "float", "")]))
+    checkpointMgrInstanceMock.load.return_value = modelInstanceMock
+
+    if snapshotHandoffClassMock is not None:
+      snapshotHandoffClassMock.isEnabled.return_value = True
+      snapshotHandoffClassMock.return_value.attach.return_value = (
+        modelInstanceMock if attachSnapshot else None)
+
+    requests = [
+      _ConsumedRequestBatch(
+        batchID="foobar",
+        ack=Mock(),
+        objects=[
+          ModelInputRow(rowID=n, data=[datetime.datetime.utcnow(), float(n)])
+          for n in xrange(numInputRows)])
+    ]
+
+    swapperMock = modelSwapperInterfaceClassMock.return_value
+    swapperMock.consumeRequests.return_value = _FakeConsumer(requests)
+
+    mr = model_runner.ModelRunner(modelID=modelID)
+
+    runnerThread = threading.Thread(target=mr.run)
+    runnerThread.setDaemon(True)
+    runnerThread.start()
+
+    runnerThread.join(timeout=5)
+    self.assertFalse(runnerThread.isAlive())
+
+    mr.close()
+
+    if attachSnapshot:
+      self.assertEqual(checkpointMgrInstanceMock.load.call_count, 0)
+    else:
+      checkpointMgrInstanceMock.load.assert_called_once_with(modelID)
+    checkpointMgrInstanceMock.loadCheckpointLog.assert_called_once_with(
+      modelID)
+
+    return checkpointMgrInstanceMock, modelInstanceMock, requests
+
+
+  def testLoadFromLegacyIncrementalAndSaveIncremental(
+      self,
+      modelCheckpointMgrClassMock,
+      modelSwapperInterfaceClassMock):
+    # Test that the input samples of a checkpoint saved before the input log
+    # are replayed before those of its input log
+    legacyInputSamples = [[datetime.datetime(2015, 1, 1, 0, 0), -1.0]]
+    logInputSamples = [[datetime.datetime(2015, 1, 1, 0, 5), -2.0]]
+
+    checkpointMgrInstanceMock, modelInstanceMock, requests = (
+      self._runIncrementalCheckpointModel(
+        modelCheckpointMgrClassMock, modelSwapperInterfaceClassMock,
+        checkpointAttributes={
+          model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME:
+            ["1", "2", "3"],
+          model_runner._ModelArchiver._INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME:
+            base64.standard_b64encode(cPickle.dumps(
+              legacyInputSamples, cPickle.HIGHEST_PROTOCOL))
+        },
+        logRecords=[self._encodeLogRecord(["4"], logInputSamples)],
+        numInputRows=2))
+
+    self.assertEqual(checkpointMgrInstanceMock.save.call_count, 0)
+    self._assertLogRecordAppended(
+      checkpointMgrInstanceMock, "abc",
+      batchIDs=[requests[0].batchID],
+      inputSamples=[row.data for row in requests[0].objects])
+
+    # The only field of the input schema is the first of the input samples
+    replayedRecords = [
+      call[0][0] for call in modelInstanceMock.run.call_args_list[:2]]
+    self.assertEqual([record["c1"] for record in replayedRecords],
+                     [legacyInputSamples[0][0], logInputSamples[0][0]])
+
+
+  def testLoadFromIncrementalAndSaveFullWhenReplayIsCostly(
+      self,
+      modelCheckpointMgrClassMock,
+      modelSwapperInterfaceClassMock):
+    # Test that a full checkpoint is saved well below the max number of input
+    # samples once replaying them on loads would cost more than a full
+    # checkpoint
+    checkpointMgrInstanceMock, _modelInstanceMock, requests = (
+      self._runIncrementalCheckpointModel(
+        modelCheckpointMgrClassMock, modelSwapperInterfaceClassMock,
+        checkpointAttributes={
+          model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME: ["1"]
+        },
+        logRecords=[
+          self._encodeLogRecord(["2"], [[datetime.datetime.utcnow(), -1.0]],
+                                replaySec=10.0, replaySecPerSample=1.0,
+                                fullCheckpointSec=5.0)],
+        numInputRows=2))
+
+    # The measured time of the full checkpoint replaces the estimate
+    logRecord = self._assertLogRecordAppended(
+      checkpointMgrInstanceMock, "abc", [requests[0].batchID], [])
+    self.assertLess(
+      logRecord[model_runner._ModelArchiver._LOG_CHECKPOINT_STATS_KEY][
+        model_runner._ModelArchiver._FULL_CHECKPOINT_SEC_STAT_NAME], 5.0)
+    checkpointMgrInstanceMock.save.assert_called_once_with(
+      modelID="abc",
+      model=checkpointMgrInstanceMock.load.return_value,
+      attributes={
+        model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME:
+          [requests[0].batchID],
+        model_runner._ModelArchiver._CHECKPOINT_STATS_ATTR_NAME: ANY,
+        model_runner._ModelArchiver._CHECKPOINT_ID_ATTR_NAME: ANY
+      })
+
+
+  @patch.object(model_runner, "ModelSnapshotHandoff", autospec=True)
+  def testLoadFromSnapshotAndSaveIncrementalWithSnapshot(
+      self,
+      snapshotHandoffClassMock,
+      modelCheckpointMgrClassMock,
+      modelSwapperInterfaceClassMock):
+    # Test that the snapshot of the current checkpoint is attached instead of
+    # loading the checkpoint and replaying its input log, and that a snapshot
+    # is published with the incremental checkpoint, which has its ID, when
+    # replaying the input log would take longer
+    checkpointMgrInstanceMock, modelInstanceMock, requests = (
+      self._runIncrementalCheckpointModel(
+        modelCheckpointMgrClassMock, modelSwapperInterfaceClassMock,
+        checkpointAttributes={
+          model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME: ["1"]
+        },
+        logRecords=[
+          self._encodeLogRecord(["2"], [[datetime.datetime.utcnow(), -1.0]],
+                                replaySecPerSample=1.0, snapshotSec=0.5,
+                                checkpointID="c2")],
+        numInputRows=2,
+        snapshotHandoffClassMock=snapshotHandoffClassMock,
+        attachSnapshot=True))
+
+    snapshotHandoffInstanceMock = snapshotHandoffClassMock.return_value
+    snapshotHandoffInstanceMock.attach.assert_called_once_with("abc", "c2")
+
+    # No input samples replayed
+    self.assertEqual(modelInstanceMock.run.call_count,
+                     len(requests[0].objects))
+
+    self.assertEqual(checkpointMgrInstanceMock.save.call_count, 0)
+    logRecord = self._assertLogRecordAppended(
+      checkpointMgrInstanceMock, "abc",
+      batchIDs=[requests[0].batchID],
+      inputSamples=[row.data for row in requests[0].objects])
+
+    checkpointID = logRecord[model_runner._ModelArchiver._LOG_CHECKPOINT_ID_KEY]
+    self.assertNotEqual(checkpointID, "c2")
+    snapshotHandoffInstanceMock.publish.assert_called_once_with(
+      "abc", modelInstanceMock, checkpointID)
+
+
+  @patch.object(model_runner, "ModelSnapshotHandoff", autospec=True)
+  def testSaveIncrementalWithoutSnapshotWhenReplayIsCheap(
+      self,
+      snapshotHandoffClassMock,
+      modelCheckpointMgrClassMock,
+      modelSwapperInterfaceClassMock):
+    # Test that the checkpoint is loaded when there's no snapshot of it, and
+    # that no snapshot is published when replaying the input log would take
+    # less time than the last snapshot did
+    checkpointMgrInstanceMock, modelInstanceMock, requests = (
+      self._runIncrementalCheckpointModel(
+        modelCheckpointMgrClassMock, modelSwapperInterfaceClassMock,
+        checkpointAttributes={
+          model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME: ["1"]
+        },
+        logRecords=[
+          self._encodeLogRecord(["2"], [[datetime.datetime.utcnow(), -1.0]],
+                                replaySecPerSample=0.001, snapshotSec=1.0,
+                                fullCheckpointSec=10.0, checkpointID="c2")],
+        numInputRows=2,
+        snapshotHandoffClassMock=snapshotHandoffClassMock))
+
+    snapshotHandoffInstanceMock = snapshotHandoffClassMock.return_value
+    snapshotHandoffInstanceMock.attach.assert_called_once_with("abc", "c2")
+
+    # The input sample of the input log replayed
+    self.assertEqual(modelInstanceMock.run.call_count,
+                     1 + len(requests[0].objects))
+
+    self.assertEqual(checkpointMgrInstanceMock.save.call_count, 0)
+    self._assertLogRecordAppended(
+      checkpointMgrInstanceMock, "abc",
+      batchIDs=[requests[0].batchID],
+      inputSamples=[row.data for row in requests[0].objects])
+    self.assertEqual(snapshotHandoffInstanceMock.publish.call_count, 0)
+
+
   @patch.object(
     model_runner, "ModelFactory", autospec=True,
     create=Mock(spec_set=model_runner.ModelFactory.create))
@@ -1212,8 +1468,10 @@ class TestModelRunner(unittest.TestCase):
                           bool(len(requests) % requestsPerCheckpoint))
       self.assertEqual(checkpointMgrInstanceMock.save.call_count, 1)
       self.assertEqual(
-        checkpointMgrInstanceMock.updateCheckpointAttributes.call_count,
-        totalCheckpoints - 1)
+        checkpointMgrInstanceMock.appendCheckpointLog.call_count,
+        totalCheckpoints)
+      self.assertEqual(
+        checkpointMgrInstanceMock.updateCheckpointAttributes.call_count, 0)
 
       self.assertEqual(swapperMock.submitResults.call_count, len(requests))
 
@@ -1307,8 +1565,10 @@ class TestModelRunner(unittest.TestCase):
 
       self.assertEqual(checkpointMgrInstanceMock.save.call_count, 1)
       self.assertEqual(
-        checkpointMgrInstanceMock.updateCheckpointAttributes.call_count,
-        totalCheckpoints - 1)
+        checkpointMgrInstanceMock.appendCheckpointLog.call_count,
+        totalCheckpoints)
+      self.assertEqual(
+        checkpointMgrInstanceMock.updateCheckpointAttributes.call_count, 0)
 
       self.assertEqual(swapperMock.submitResults.call_count, len(requests) // 2)
 
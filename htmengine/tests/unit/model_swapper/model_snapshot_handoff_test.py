@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Unit tests for the Model Swapper's ModelSnapshotHandoff class
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+from mock import patch
+
+
+from nupic.frameworks.opf.modelfactory import ModelFactory
+
+from htmengine.model_swapper import model_snapshot_handoff
+from htmengine.model_swapper.model_snapshot_handoff import ModelSnapshotHandoff
+
+from nta.utils.logging_support_raw import LoggingSupport
+
+
+
+# Disable warning: Access to a protected member
+# pylint: disable=W0212
+
+
+
+def setUpModule():
+  LoggingSupport.initTestApp()
+
+
+
+class _TestModel(object):
+
+  def __init__(self, name):
+    self.name = name
+
+
+  def save(self, saveModelDir):
+    os.mkdir(saveModelDir)
+    with open(os.path.join(saveModelDir, "model.txt"), "w") as fileObj:
+      fileObj.write(self.name)
+
+
+
+class ModelSnapshotHandoffTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    self.root = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.root)
+
+    patcher = patch.object(ModelSnapshotHandoff, "_getConfig", autospec=True,
+                           side_effect=lambda: (self.root, 300))
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+    patcher = patch.object(
+      ModelFactory, "loadFromCheckpoint", autospec=True,
+      side_effect=lambda path: open(os.path.join(path, "model.txt")).read())
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+
+  def _getSnapshotModelIDs(self):
+    return [name for name in os.listdir(self.root) if not name.startswith(".")]
+
+
+  def testPublishAndAttach(self):
+    handoff = ModelSnapshotHandoff()
+
+    handoff.publish("abc", _TestModel("m1"), checkpointID="c1")
+    self.assertEqual(self._getSnapshotModelIDs(), ["abc"])
+
+    # Attached by another process
+    self.assertEqual(ModelSnapshotHandoff().attach("abc", checkpointID="c1"),
+                     "m1")
+
+    # Consumed
+    self.assertEqual(self._getSnapshotModelIDs(), [])
+    self.assertIsNone(handoff.attach("abc", checkpointID="c1"))
+    self.assertEqual(os.listdir(handoff._scratchDir), [])
+
+
+  def testPublishReplacesSnapshot(self):
+    handoff = ModelSnapshotHandoff()
+
+    handoff.publish("abc", _TestModel("m1"), checkpointID="c1")
+    handoff.publish("abc", _TestModel("m2"), checkpointID="c2")
+
+    self.assertEqual(handoff.attach("abc", checkpointID="c2"), "m2")
+
+
+  def testSnapshotOfOtherCheckpointIsDiscarded(self):
+    # E.g., the publisher failed to save its checkpoint, or a later run saved
+    # a checkpoint without publishing a snapshot
+    handoff = ModelSnapshotHandoff()
+
+    handoff.publish("abc", _TestModel("m1"), checkpointID="c1")
+
+    self.assertIsNone(handoff.attach("abc", checkpointID="c2"))
+    self.assertEqual(ModelFactory.loadFromCheckpoint.call_count, 0)
+    self.assertEqual(self._getSnapshotModelIDs(), [])
+
+
+  def testFailedPublishLeavesPreviousSnapshot(self):
+    handoff = ModelSnapshotHandoff()
+
+    handoff.publish("abc", _TestModel("m1"), checkpointID="c1")
+
+    with patch.object(_TestModel, "save", autospec=True,
+                      side_effect=IOError("No space left on device")):
+      with self.assertRaises(IOError):
+        handoff.publish("abc", _TestModel("m2"), checkpointID="c2")
+
+    self.assertEqual(os.listdir(handoff._scratchDir), [])
+    self.assertEqual(handoff.attach("abc", checkpointID="c1"), "m1")
+
+
+  def testRemoveStaleSnapshots(self):
+    handoff = ModelSnapshotHandoff()
+
+    handoff.publish("abc", _TestModel("m1"), checkpointID="c1")
+    handoff.publish("def", _TestModel("m2"), checkpointID="c2")
+
+    self.assertEqual(handoff.removeStaleSnapshots(), 0)
+
+    now = time.time()
+    with patch.object(model_snapshot_handoff.time, "time", autospec=True,
+                      return_value=now + 301):
+      self.assertEqual(handoff.removeStaleSnapshots(), 2)
+
+    self.assertEqual(self._getSnapshotModelIDs(), [])
+
+
+  def testPublishRemovesStaleSnapshotsOncePerQuarterOfMaxAge(self):
+    handoff = ModelSnapshotHandoff()
+
+    with patch.object(ModelSnapshotHandoff, "removeStaleSnapshots",
+                      autospec=True) as removeStaleSnapshotsMock:
+      handoff.publish("abc", _TestModel("m1"), checkpointID="c1")
+      handoff.publish("def", _TestModel("m2"), checkpointID="c2")
+      self.assertEqual(removeStaleSnapshotsMock.call_count, 1)
+
+      now = time.time()
+      with patch.object(model_snapshot_handoff.time, "time", autospec=True,
+                        return_value=now + 76):
+        handoff.publish("ghi", _TestModel("m3"), checkpointID="c3")
+      self.assertEqual(removeStaleSnapshotsMock.call_count, 2)
+
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1002,6 +1002,31 @@ class ModelSwapperInterfaceTestCase(unittest.TestCase):
     self.assertEqual(set(actualModelsWithInput), expectedSet)
 
 
+  @patch.object(model_swapper_interface, "MessageBusConnector", autospec=True)
+  def testGetModelIDsWithInputQueues(self, messageBusConnectorClassMock):
+    modelIDs = ("model_one", "model_two", "model_three")
+
+    with ModelSwapperInterface() as interface:
+      allMessageQueues = [interface._getModelInputQName(modelID)
+                          for modelID in modelIDs]
+
+    # Add some queue names that don't look like model input queue names
+    allMessageQueues.extend(
+      ("not.model.input.queue1", "not.model.input.queue2"))
+
+    messageBusConnectorMock = messageBusConnectorClassMock.return_value
+    messageBusConnectorMock.getAllMessageQueues.return_value = (
+      allMessageQueues)
+
+    with ModelSwapperInterface() as interface:
+      actualModelIDs = interface.getModelIDsWithInputQueues()
+
+    self.assertItemsEqual(actualModelIDs, modelIDs)
+
+    # Input queues are not inspected for pending input
+    self.assertEqual(messageBusConnectorMock.isEmpty.call_count, 0)
+
+
   @patch.object(model_swapper_interface, "MessageBusConnector", autospec=True)
   def testSubmitResults(self, messageBusConnectorClassMock):
     results = [
@@ -23,6 +23,11 @@
 table and the corresponding dynamodb table. Metrics (and their attributes) in
 the dynamodb taurs.metric.<environment> table must match the ACTIVE models in
 the mysql taurus.metric table. Return non-zero result code if errors are found.
+
+With --sources, model IDs are instead cross-checked in a single streaming pass
+over several sources (repository, model checkpoints, model input queues and
+DynamoDB), optionally writing a JSON report with a repair plan; see
+taurus_engine.model_id_consistency.
 """
 
 import argparse
@@ -35,9 +40,13 @@ import boto.dynamodb2.table
 from nta.utils.dynamodb_utils import retryOnTransientDynamoDBError
 from nta.utils.error_handling import logExceptions
 
+from htmengine.model_checkpoint_mgr import model_checkpoint_mgr
+from htmengine.model_swapper.model_swapper_interface import (
+  ModelSwapperInterface)
 from htmengine.repository.queries import MetricStatus
 
 from taurus_engine import logging_support
+from taurus_engine import model_id_consistency
 from taurus_engine import repository
 
 from taurus_engine.runtime.dynamodb import dynamodb_service
@@ -60,6 +69,11 @@ def _parseArgs(args):
       verbose: True for verbose mode
       warningsAsErrors: True to treat warnings as errors, returning non-zero
         result code for warnings just like for errors.
+      sources: None for the repository vs. DynamoDB checks; otherwise,
+        sequence of names of the sources to cross-check
+      reportPath: path of the JSON report file, "-" for stdout, or None
+      repairPlan: True to include the repair plan in the report
+      scanSegments: number of segments of the parallel DynamoDB scan
   """
   parser = argparse.ArgumentParser(description=__doc__)
 
@@ -76,7 +90,63 @@ def _parseArgs(args):
     dest="warningsAsErrors",
     help="Warnings will result in non-zero result code.")
 
-  return parser.parse_args(args)
+  parser.add_argument(
+    "--sources",
+    type=_parseSourceNames,
+    dest="sources",
+    help=("Comma-separated model ID sources to cross-check in a streaming "
+          "pass instead of running the repository vs. DynamoDB checks; any "
+          "of {}").format(",".join(model_id_consistency.ALL_SOURCES)))
+
+  parser.add_argument(
+    "--report",
+    dest="reportPath",
+    metavar="PATH",
+    help=("Write the machine-readable cross-check report as JSON to PATH "
+          "(- for stdout); requires --sources"))
+
+  parser.add_argument(
+    "--repairPlan",
+    action="store_true",
+    dest="repairPlan",
+    help="Include the repair plan in the report")
+
+  parser.add_argument(
+    "--scanSegments",
+    type=int,
+    default=model_id_consistency.DEFAULT_DYNAMODB_SCAN_SEGMENTS,
+    dest="scanSegments",
+    help=("Number of segments of the parallel DynamoDB scan "
+          "[default: %(default)s]"))
+
+  args = parser.parse_args(args)
+
+  if args.sources is None and (args.reportPath or args.repairPlan):
+    parser.error("--report and --repairPlan require --sources")
+
+  if args.scanSegments < 1:
+    parser.error("--scanSegments must be positive")
+
+  return args
+
+
+
+def _parseSourceNames(value):
+  """ argparse type of --sources
+
+  :returns: tuple of source names in the order of
+    model_id_consistency.ALL_SOURCES
+  """
+  names = set(name.strip() for name in value.split(",") if name.strip())
+
+  unknownNames = names.difference(model_id_consistency.ALL_SOURCES)
+  if unknownNames or not names:
+    raise argparse.ArgumentTypeError(
+      "Expected comma-separated names of sources among {}, but got {!r}".format(
+        ",".join(model_id_consistency.ALL_SOURCES), value))
+
+  return tuple(name for name in model_id_consistency.ALL_SOURCES
+               if name in names)
 
 
 
@@ -239,38 +309,9 @@ def _checkModelAttributeParity(engineMetrics,
   mismatches = []
 
   for uid in commonMetricIds:
-    diffs = []
-
-    activeModel = activeModelsMap[uid]
-    dynamodbModel = dynamodbModelsMap[uid]
-
-    if activeModel["name"] != dynamodbModel["name"]:
-      diffs.append(("name",
-                    activeModel["name"],
-                    dynamodbModel["name"]))
-
-    if activeModel["server"] != dynamodbModel["display_name"]:
-      diffs.append(("display_name",
-                    activeModel["server"],
-                    dynamodbModel["display_name"]))
-
-    activeModelConfig = json.loads(activeModel["parameters"])
-    activeModelUserInfo = activeModelConfig["metricSpec"]["userInfo"]
-
-    if activeModelUserInfo["metricType"] != dynamodbModel["metricType"]:
-      diffs.append(("metricType",
-                    activeModelUserInfo["metricType"],
-                    dynamodbModel["metricType"]))
-
-    if activeModelUserInfo["metricTypeName"] != dynamodbModel["metricTypeName"]:
-      diffs.append(("metricTypeName",
-                    activeModelUserInfo["metricTypeName"],
-                    dynamodbModel["metricTypeName"]))
-
-    if activeModelUserInfo["symbol"] != dynamodbModel["symbol"]:
-      diffs.append(("symbol",
-                    activeModelUserInfo["symbol"],
-                    dynamodbModel["symbol"]))
+    diffs = model_id_consistency.diffModelAttributes(
+      repositoryMetric=activeModelsMap[uid],
+      dynamodbMetric=dynamodbModelsMap[uid])
 
     if diffs:
       mismatches.append((uid, diffs))
@@ -435,6 +476,116 @@ def checkAndReport(verbose, warningsAsErrors):
 
 
 
+def _createModelIdSources(sourceNames, swapperInterface, scanSegments):
+  """Create the model ID sources of the cross-check
+
+  :param sourceNames: sequence of names of the sources to create
+  :param swapperInterface: ModelSwapperInterface instance for listing the
+    model input queues
+  :param int scanSegments: number of segments of the parallel DynamoDB scan
+
+  :returns: sequence of model_id_consistency.ModelIdSource objects
+  """
+  def iterRepositoryEntries():
+    return model_id_consistency.iterRepositoryEntries(
+      repository.engineFactory())
+
+  def iterCheckpointEntries():
+    return model_id_consistency.iterCheckpointEntries(
+      model_checkpoint_mgr.ModelCheckpointMgr())
+
+  def iterInputQueueEntries():
+    return model_id_consistency.iterInputQueueEntries(swapperInterface)
+
+  def createMetricTable():
+    return boto.dynamodb2.table.Table(
+      table_name=MetricDynamoDBDefinition().tableName,
+      connection=dynamodb_service.DynamoDBService.connectDynamoDB())
+
+  def iterDynamoDBEntries():
+    return model_id_consistency.iterDynamoDBEntries(
+      tableFactory=createMetricTable,
+      totalSegments=scanSegments)
+
+  factories = {
+    model_id_consistency.REPOSITORY: iterRepositoryEntries,
+    model_id_consistency.CHECKPOINTS: iterCheckpointEntries,
+    model_id_consistency.INPUT_QUEUES: iterInputQueueEntries,
+    model_id_consistency.DYNAMODB: iterDynamoDBEntries
+  }
+
+  return tuple(model_id_consistency.ModelIdSource(name, factories[name])
+               for name in sourceNames)
+
+
+
+def crossCheckAndReport(sourceNames, verbose, warningsAsErrors,
+                        reportPath=None, repairPlan=False,
+                        scanSegments=(
+                          model_id_consistency.DEFAULT_DYNAMODB_SCAN_SEGMENTS)):
+  """Cross-check model IDs of the given sources in a streaming pass and report
+  findings
+
+  :param sourceNames: sequence of names of the sources to cross-check; see
+    model_id_consistency.ALL_SOURCES
+  :param bool verbose: True for verbose mode
+  :param bool warningsAsErrors: True to treat warnings as errors, returning
+    non-zero result code on warnings just as for errors.
+  :param reportPath: path of the JSON report file, "-" for stdout, or None to
+    only log findings
+  :param bool repairPlan: True to include the repair plan in the report
+  :param int scanSegments: number of segments of the parallel DynamoDB scan
+
+  :returns: 0 if there are no errors (nor warnings if warningsAsErrors);
+    1 otherwise
+  """
+  with ModelSwapperInterface() as swapperInterface:
+    sources = _createModelIdSources(sourceNames=sourceNames,
+                                    swapperInterface=swapperInterface,
+                                    scanSegments=scanSegments)
+
+    report = model_id_consistency.crossCheck(sources,
+                                             includeRepairPlan=repairPlan)
+
+  if verbose:
+    for name in sourceNames:
+      g_log.info("There are %s models in %s", report["modelCounts"][name],
+                 name)
+    g_log.info("Cross-checked %s models in %ss", report["numModels"],
+               report["durationSec"])
+
+  for finding in report["findings"]:
+    if finding["severity"] == model_id_consistency.ERROR:
+      g_log.error("%s - %s: %s", finding["kind"], finding["modelId"],
+                  finding["message"])
+    else:
+      g_log.warn("%s - %s: %s", finding["kind"], finding["modelId"],
+                 finding["message"])
+
+  if report["numWarnings"]:
+    g_log.warn("Warnings: %s", report["numWarnings"])
+  elif verbose:
+    g_log.info("Warnings: 0")
+
+  if report["numErrors"]:
+    g_log.error("Errors: %s", report["numErrors"])
+  elif verbose:
+    g_log.info("Errors: 0")
+
+  if reportPath == "-":
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write("\n")
+  elif reportPath:
+    with open(reportPath, "w") as fileObj:
+      json.dump(report, fileObj, indent=2, sort_keys=True)
+
+  if report["numErrors"] or (report["numWarnings"] and warningsAsErrors):
+    return 1
+  else:
+    return 0
+
+
+
 @logExceptions(g_log)
 def main(args=sys.argv[1:]):
   """Console Script entry point
@@ -455,6 +606,14 @@ def main(args=sys.argv[1:]):
     raise
 
 
+  if args.sources is not None:
+    return crossCheckAndReport(sourceNames=args.sources,
+                               verbose=args.verbose,
+                               warningsAsErrors=args.warningsAsErrors,
+                               reportPath=args.reportPath,
+                               repairPlan=args.repairPlan,
+                               scanSegments=args.scanSegments)
+
   return checkAndReport(verbose=args.verbose,
                         warningsAsErrors=args.warningsAsErrors)
 
@@ -0,0 +1,486 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+""" Streaming cross-check of the model IDs known to the parts of Taurus Engine.
+
+Each source yields (modelId, attributes) two-tuples in ascending modelId order:
+the repository pages through the metric table by uid, the checkpoint and input
+queue sources sort the IDs they list, and DynamoDB is read with a parallel
+segmented scan of just the attributes that are checked. The sorted streams are
+merged so that the presence of one model across all sources is examined at a
+time by the checks in `CHECKS`, each of which yields `Finding` objects. The
+findings are summarized in a JSON-serializable report together with a plan of
+`RepairAction` objects; nothing is repaired by this module.
+"""
+
+from collections import namedtuple
+import heapq
+import itertools
+import json
+from multiprocessing.pool import ThreadPool
+from operator import itemgetter
+import time
+
+import sqlalchemy as sql
+
+from nta.utils.dynamodb_utils import retryOnTransientDynamoDBError
+from nta.utils.sqlalchemy_utils import retryOnTransientErrors
+
+from htmengine.repository.queries import MetricStatus
+
+from taurus_engine import taurus_logging
+from taurus_engine.repository import schema
+
+
+
+g_log = taurus_logging.getExtendedLogger(__name__)
+
+
+
+# Source names
+REPOSITORY = "repository"
+CHECKPOINTS = "checkpoints"
+INPUT_QUEUES = "input_queues"
+DYNAMODB = "dynamodb"
+
+ALL_SOURCES = (REPOSITORY, CHECKPOINTS, INPUT_QUEUES, DYNAMODB)
+
+
+# Finding severities
+ERROR = "error"
+WARNING = "warning"
+
+
+# Repair actions
+DELETE_CHECKPOINT = "delete_checkpoint"
+DELETE_INPUT_QUEUE = "delete_input_queue"
+DELETE_DYNAMODB_METRIC = "delete_dynamodb_metric"
+CREATE_INPUT_QUEUE = "create_input_queue"
+RECREATE_MODEL = "recreate_model"
+REPUBLISH_TO_DYNAMODB = "republish_to_dynamodb"
+
+
+DEFAULT_REPOSITORY_PAGE_SIZE = 1000
+
+DEFAULT_DYNAMODB_SCAN_SEGMENTS = 4
+
+
+
+# A source of model IDs
+#
+# name: source name; e.g., REPOSITORY
+# iterSortedEntries: function that takes no args and returns an iterable of
+#   (modelId, attributes) two-tuples in ascending modelId order without
+#   duplicate modelIds; attributes is a dict of the source's attributes of the
+#   model that are used by checks
+ModelIdSource = namedtuple("ModelIdSource", "name iterSortedEntries")
+
+
+# The presence of a model across sources
+#
+# modelId: the model ID
+# entries: dict of source name -> attributes of the model in the sources that
+#   have the model
+ModelPresence = namedtuple("ModelPresence", "modelId entries")
+
+
+# An inconsistency found by a check
+#
+# modelId: the model ID
+# severity: ERROR or WARNING
+# kind: short identifier of the kind of inconsistency; e.g.,
+#   "not_in_repository"
+# message: human-readable description
+# repair: sequence of RepairAction objects that would resolve the finding;
+#   empty if it needs to be resolved manually
+Finding = namedtuple("Finding", "modelId severity kind message repair")
+
+
+# A step of the repair plan
+#
+# modelId: the model ID
+# action: one of the repair action constants; e.g., DELETE_CHECKPOINT
+# source: name of the source that the action modifies
+RepairAction = namedtuple("RepairAction", "modelId action source")
+
+
+
+def iterRepositoryEntries(engine, pageSize=DEFAULT_REPOSITORY_PAGE_SIZE):
+  """ Yield the metrics in the repository in uid order, one page at a time
+  (keyset pagination by uid)
+
+  :param sqlalchemy.engine.Engine engine:
+  :param int pageSize: max number of metric rows fetched per query
+  :returns: generator of (uid, attributes) two-tuples, where attributes is a
+    dict with the metric's status, name, server and parameters
+  """
+  columns = [schema.metric.c.uid,
+             schema.metric.c.status,
+             schema.metric.c.name,
+             schema.metric.c.server,
+             schema.metric.c.parameters]
+
+  @retryOnTransientErrors
+  def fetchPage(afterUid):
+    sel = (sql.select(columns)
+           .order_by(schema.metric.c.uid)
+           .limit(pageSize))
+    if afterUid is not None:
+      sel = sel.where(schema.metric.c.uid > afterUid)
+
+    with engine.connect() as conn:
+      return conn.execute(sel).fetchall()
+
+  afterUid = None
+  while True:
+    rows = fetchPage(afterUid)
+
+    for row in rows:
+      yield row.uid, dict(status=row.status,
+                          name=row.name,
+                          server=row.server,
+                          parameters=row.parameters)
+
+    if len(rows) < pageSize:
+      return
+
+    afterUid = rows[-1].uid
+
+
+
+def iterCheckpointEntries(checkpointMgr):
+  """ Yield the IDs of the models in checkpoint storage in sorted order
+
+  :param checkpointMgr: htmengine.model_checkpoint_mgr.ModelCheckpointMgr
+    instance
+  :returns: generator of (modelId, {}) two-tuples
+  """
+  for modelId in sorted(checkpointMgr.getModelIDs()):
+    yield modelId, {}
+
+
+
+def iterInputQueueEntries(swapperInterface):
+  """ Yield the IDs of the models that have an input queue in sorted order
+
+  :param swapperInterface: htmengine.model_swapper.model_swapper_interface.
+    ModelSwapperInterface instance
+  :returns: generator of (modelId, {}) two-tuples
+  """
+  for modelId in sorted(swapperInterface.getModelIDsWithInputQueues()):
+    yield modelId, {}
+
+
+
+def iterDynamoDBEntries(tableFactory,
+                        totalSegments=DEFAULT_DYNAMODB_SCAN_SEGMENTS):
+  """ Scan the DynamoDB metric table with a parallel segmented scan and yield
+  its items in uid order. Only the attributes used by the checks are fetched.
+  The uids of the whole table are sorted in memory since a scan has no order.
+
+  :param tableFactory: function that takes no args and returns a new
+    boto.dynamodb2.table.Table of the metric table; called once per segment,
+    since each segment is scanned by its own thread
+  :param int totalSegments: number of segments scanned concurrently
+  :returns: generator of (uid, attributes) two-tuples, where attributes is a
+    dict with the item's name, display_name, metricType, metricTypeName and
+    symbol
+  """
+  attributeNames = ("uid", "name", "display_name", "metricType",
+                    "metricTypeName", "symbol")
+
+  @retryOnTransientDynamoDBError(g_log)
+  def scanSegment(segment):
+    table = tableFactory()
+    entries = [
+      (item["uid"], dict((name, item[name]) for name in attributeNames[1:]))
+      for item in table.scan(segment=segment,
+                             total_segments=totalSegments,
+                             attributes=attributeNames)]
+    entries.sort(key=itemgetter(0))
+    return entries
+
+  pool = ThreadPool(processes=totalSegments)
+  try:
+    segments = pool.map(scanSegment, xrange(totalSegments))
+  finally:
+    pool.close()
+    pool.join()
+
+  for entry in heapq.merge(*segments):
+    yield entry
+
+
+
+def _tagEntries(source, index):
+  """ Tag the entries of a source with the source's index for merging, and
+  check that they are in strictly ascending modelId order
+
+  :raises ValueError: if the entries are not sorted
+  """
+  previousModelId = None
+  for modelId, attributes in source.iterSortedEntries():
+    if previousModelId is not None and modelId <= previousModelId:
+      raise ValueError("Model IDs of source=%s are not in strictly ascending "
+                       "order: %r after %r" % (source.name, modelId,
+                                               previousModelId))
+    previousModelId = modelId
+
+    yield modelId, index, attributes
+
+
+
+def iterModelPresence(sources):
+  """ Merge the sorted entries of the given sources
+
+  :param sources: sequence of ModelIdSource objects
+  :returns: generator of ModelPresence objects in ascending modelId order; one
+    per model ID found in any of the sources
+  """
+  merged = heapq.merge(*[_tagEntries(source, index)
+                         for index, source in enumerate(sources)])
+
+  for modelId, group in itertools.groupby(merged, key=itemgetter(0)):
+    yield ModelPresence(
+      modelId=modelId,
+      entries=dict((sources[index].name, attributes)
+                   for _, index, attributes in group))
+
+
+
+def diffModelAttributes(repositoryMetric, dynamodbMetric):
+  """ Compare the attributes of a metric in the repository with those of its
+  item in the DynamoDB metric table
+
+  :param repositoryMetric: dict-like metric row with name, server and
+    parameters
+  :param dynamodbMetric: dict-like metric item with name, display_name,
+    metricType, metricTypeName and symbol
+  :returns: list of (attribute name, repository value, dynamodb value)
+    three-tuples of the attributes that differ
+  """
+  diffs = []
+
+  if repositoryMetric["name"] != dynamodbMetric["name"]:
+    diffs.append(("name",
+                  repositoryMetric["name"],
+                  dynamodbMetric["name"]))
+
+  if repositoryMetric["server"] != dynamodbMetric["display_name"]:
+    diffs.append(("display_name",
+                  repositoryMetric["server"],
+                  dynamodbMetric["display_name"]))
+
+  userInfo = json.loads(repositoryMetric["parameters"])["metricSpec"][
+    "userInfo"]
+
+  for attributeName in ("metricType", "metricTypeName", "symbol"):
+    if userInfo[attributeName] != dynamodbMetric[attributeName]:
+      diffs.append((attributeName,
+                    userInfo[attributeName],
+                    dynamodbMetric[attributeName]))
+
+  return diffs
+
+
+
+def _checkNotInRepository(presence, sourceNames):
+  """ Models in other sources must be in the repository """
+  if REPOSITORY not in sourceNames or REPOSITORY in presence.entries:
+    return
+
+  repairActionBySource = {CHECKPOINTS: DELETE_CHECKPOINT,
+                          INPUT_QUEUES: DELETE_INPUT_QUEUE,
+                          DYNAMODB: DELETE_DYNAMODB_METRIC}
+
+  presentIn = sorted(presence.entries)
+
+  yield Finding(
+    modelId=presence.modelId,
+    severity=ERROR,
+    kind="not_in_repository",
+    message="Model is in {} but not in repository".format(
+      ", ".join(presentIn)),
+    repair=[RepairAction(presence.modelId, repairActionBySource[name], name)
+            for name in presentIn])
+
+
+
+def _checkActiveModel(presence, sourceNames):
+  """ Active models must have a checkpoint, an input queue and a metric item in
+  DynamoDB with the same attributes as in the repository
+  """
+  metric = presence.entries.get(REPOSITORY)
+  if metric is None or metric["status"] != MetricStatus.ACTIVE:
+    return
+
+  modelId = presence.modelId
+
+  if CHECKPOINTS in sourceNames and CHECKPOINTS not in presence.entries:
+    yield Finding(
+      modelId=modelId,
+      severity=ERROR,
+      kind="active_model_without_checkpoint",
+      message="Active model {} has no checkpoint".format(metric["name"]),
+      repair=[RepairAction(modelId, RECREATE_MODEL, CHECKPOINTS)])
+
+  if INPUT_QUEUES in sourceNames and INPUT_QUEUES not in presence.entries:
+    yield Finding(
+      modelId=modelId,
+      severity=ERROR,
+      kind="active_model_without_input_queue",
+      message="Active model {} has no input queue".format(metric["name"]),
+      repair=[RepairAction(modelId, CREATE_INPUT_QUEUE, INPUT_QUEUES)])
+
+  if DYNAMODB in sourceNames:
+    dynamodbMetric = presence.entries.get(DYNAMODB)
+    if dynamodbMetric is None:
+      yield Finding(
+        modelId=modelId,
+        severity=ERROR,
+        kind="active_model_not_in_dynamodb",
+        message="Active model {} is not in DynamoDB".format(metric["name"]),
+        repair=[RepairAction(modelId, REPUBLISH_TO_DYNAMODB, DYNAMODB)])
+    else:
+      diffs = diffModelAttributes(metric, dynamodbMetric)
+      if diffs:
+        yield Finding(
+          modelId=modelId,
+          severity=ERROR,
+          kind="attribute_mismatch",
+          message="Model attributes in repository vs DynamoDB: {}".format(
+            [tuple(str(item) for item in diff) for diff in diffs]),
+          repair=[RepairAction(modelId, REPUBLISH_TO_DYNAMODB, DYNAMODB)])
+
+
+
+def _checkInactiveModel(presence, sourceNames):  # pylint: disable=W0613
+  """ Only active models belong in DynamoDB; unmonitored models have no
+  checkpoint or input queue, and models in error state are reported
+  """
+  metric = presence.entries.get(REPOSITORY)
+  if metric is None or metric["status"] == MetricStatus.ACTIVE:
+    return
+
+  modelId = presence.modelId
+  status = metric["status"]
+
+  if status == MetricStatus.ERROR:
+    # It's a warning as far as this check is concerned. If the model failed
+    # during creation, we don't expect it to be in dynamodb.
+    yield Finding(
+      modelId=modelId,
+      severity=WARNING,
+      kind="model_in_error_state",
+      message="Model {} is in error state".format(metric["name"]),
+      repair=[])
+
+  if DYNAMODB in presence.entries:
+    yield Finding(
+      modelId=modelId,
+      severity=ERROR,
+      kind="inactive_model_in_dynamodb",
+      message="Model {} with status={} is in DynamoDB".format(metric["name"],
+                                                               status),
+      repair=[RepairAction(modelId, DELETE_DYNAMODB_METRIC, DYNAMODB)])
+
+  if status == MetricStatus.UNMONITORED:
+    for name, action in ((CHECKPOINTS, DELETE_CHECKPOINT),
+                         (INPUT_QUEUES, DELETE_INPUT_QUEUE)):
+      if name in presence.entries:
+        yield Finding(
+          modelId=modelId,
+          severity=WARNING,
+          kind="unmonitored_model_in_" + name,
+          message="Unmonitored metric {} is in {}".format(metric["name"],
+                                                          name),
+          repair=[RepairAction(modelId, action, name)])
+
+
+
+# Checks run for each model. A check is a function that takes a ModelPresence
+# object and the set of names of the sources that were read, and returns an
+# iterable of Finding objects.
+CHECKS = (_checkNotInRepository, _checkActiveModel, _checkInactiveModel)
+
+
+
+def crossCheck(sources, checks=CHECKS, includeRepairPlan=False):
+  """ Cross-check the model IDs of the given sources
+
+  :param sources: sequence of ModelIdSource objects
+  :param checks: sequence of check functions; see `CHECKS`
+  :param bool includeRepairPlan: True to add the repair plan to the report
+
+  :returns: JSON-serializable report dict with the following keys:
+      sources: names of the sources that were read
+      modelCounts: dict of source name -> number of models in the source
+      numModels: number of distinct model IDs across all sources
+      durationSec: duration of the cross-check in seconds
+      numErrors: number of error findings
+      numWarnings: number of warning findings
+      findingCounts: dict of finding kind -> number of findings
+      findings: list of dicts with the fields of each Finding except repair
+      repairPlan: present only if includeRepairPlan; list of dicts with the
+        fields of each RepairAction, ordered by action
+  """
+  startTime = time.time()
+
+  sourceNames = frozenset(source.name for source in sources)
+  modelCounts = dict((source.name, 0) for source in sources)
+  numModels = 0
+  findings = []
+
+  for presence in iterModelPresence(sources):
+    numModels += 1
+    for name in presence.entries:
+      modelCounts[name] += 1
+
+    for check in checks:
+      findings.extend(check(presence, sourceNames))
+
+  findingCounts = {}
+  for finding in findings:
+    findingCounts[finding.kind] = findingCounts.get(finding.kind, 0) + 1
+
+  report = {
+    "sources": [source.name for source in sources],
+    "modelCounts": modelCounts,
+    "numModels": numModels,
+    "durationSec": round(time.time() - startTime, 3),
+    "numErrors": sum(1 for finding in findings if finding.severity == ERROR),
+    "numWarnings": sum(1 for finding in findings
+                       if finding.severity == WARNING),
+    "findingCounts": findingCounts,
+    "findings": [dict(modelId=finding.modelId,
+                      severity=finding.severity,
+                      kind=finding.kind,
+                      message=finding.message)
+                 for finding in findings]
+  }
+
+  if includeRepairPlan:
+    repairPlan = sorted(
+      set(action for finding in findings for action in finding.repair),
+      key=lambda action: (action.action, action.source, action.modelId))
+    report["repairPlan"] = [action._asdict() for action in repairPlan]
+
+  return report
@@ -29,6 +29,7 @@ client.
 
 from datetime import datetime, timedelta
 from decimal import Context, Underflow, Clamped, Overflow
+from functools import partial
 import json
 import os
 import sys
@@ -51,6 +52,12 @@ from taurus_engine.runtime.dynamodb.definitions import (
   MetricDynamoDBDefinition,
   MetricDataDynamoDBDefinition,
   MetricTweetsDynamoDBDefinition)
+from taurus_engine.runtime.dynamodb.dynamodb_write_pipeline import (
+  CallableWrite,
+  DynamoDBWritePipeline,
+  MetricDataWrite)
+from taurus_engine.runtime.dynamodb.instance_data_hourly_cache import (
+  InstanceDataHourlyCache)
 
 from htmengine import htmengineerrno, utils
 from htmengine.runtime.anomaly_service import AnomalyService
@@ -255,46 +262,72 @@ class DynamoDBService(object):
     return boto.dynamodb2.connect_to_region(region, **connectKwargs)
 
 
-  def _publishMetricData(self, metricId, rows):
-    """ Specific handler for metric data rows.  Publishes to the
-    `taurus.data.metric_data` dynamodb table.
+  @staticmethod
+  def _convertMetricDataRows(metricId, rows):
+    """ Convert model inference result rows to `taurus.data.metric_data` items,
+    dropping rows with duplicate timestamps.
 
     :param str metricId: unique metric identifier
     :param rows: model inference result rows per "results" property of
       htmengine/runtime/json_schema/model_inference_results_msg_schema.json
     :type rows: Sequence of dicts
+    :returns: metric_data item dicts
+    :rtype: list
+    """
+    items = []
+    processedKeys = set()
+    for row in rows:
+      data=convertInferenceResultRowToMetricDataItem(metricId, row)
+
+      # Safeguard against erroneously-provided duplicate timestamp in batch
+      key = (data.uid, data.timestamp)
+      if key in processedKeys:
+        # This would trigger ValidationException from DynamoDB with the
+        # message "Provided list of item keys contains duplicates"
+        g_log.error("Duplicate metric_data key in batch write: data=%r from "
+                    "row=%r from batchLen=%d", data, row, len(rows))
+        continue
+
+      items.append(data._asdict())
+      processedKeys.add(key)
+
+    return items
+
+
+  def _writeMetricDataItems(self, items):
+    """ Write items to the `taurus.data.metric_data` dynamodb table using batch
+    writes of up to 25 items each. Items must have unique keys.
+
+    :param items: metric_data item dicts
+    :type items: Sequence of dicts
     """
     with self._metric_data.batch_write() as dynamodbBatchWrite:
-      processedKeys = set()
-      for row in rows:
-        data=convertInferenceResultRowToMetricDataItem(metricId, row)
-
-        # Safeguard against erroneously-provided duplicate timestamp in batch
-        key = (data.uid, data.timestamp)
-        if key in processedKeys:
-          # This would trigger ValidationException from DynamoDB with the
-          # message "Provided list of item keys contains duplicates"
-          g_log.error("Duplicate metric_data key in batch write: data=%r from "
-                      "row=%r from batchLen=%d", data, row, len(rows))
-          continue
+      for item in items:
+        dynamodbBatchWrite.put_item(data=item, overwrite=True)
 
-        dynamodbBatchWrite.put_item(data=data._asdict(), overwrite=True)
-        processedKeys.add(key)
 
+  def _publishMetricData(self, metricId, rows):
+    """ Specific handler for metric data rows.  Publishes to the
+    `taurus.data.metric_data` dynamodb table.
 
-  def _publishInstanceDataHourly(self, instanceName, metricType, rows):
-    """ Specific handler for instance data rows.  Publishes to the
-    `taurus.data.instance_data_hourly` dynamodb table.
+    :param str metricId: unique metric identifier
+    :param rows: model inference result rows per "results" property of
+      htmengine/runtime/json_schema/model_inference_results_msg_schema.json
+    :type rows: Sequence of dicts
+    """
+    self._writeMetricDataItems(self._convertMetricDataRows(metricId, rows))
 
-    :param instanceName: name of the instance
-    :type instanceName: str
 
-    :param metricType: the metric type identifier
-    :type metricType: str
+  @staticmethod
+  def _computeHourlyMaxScores(rows):
+    """ Compute the maximum anomaly score per hour of model inference results
 
     :param rows: model inference result rows per "results" property of
       htmengine/runtime/json_schema/model_inference_results_msg_schema.json
     :type rows: Sequence of dicts
+    :returns: map of hour (datetime truncated to the hour) to the maximum
+      anomaly score of the rows in that hour
+    :rtype: dict
     """
     hourToMaxScore = {}
     for row in rows:
@@ -305,106 +338,138 @@ class DynamoDBService(object):
       # Store the max anomaly likelihood for the period
       hourToMaxScore[ts] = max(hourToMaxScore.get(ts, 0.0),
                                row["anomaly"])
+    return hourToMaxScore
+
+
+  def _publishInstanceDataHourly(self, instanceName, metricType, rows):
+    """ Specific handler for instance data rows.  Publishes to the
+    `taurus.data.instance_data_hourly` dynamodb table.
+
+    :param instanceName: name of the instance
+    :type instanceName: str
+
+    :param metricType: the metric type identifier
+    :type metricType: str
+
+    :param rows: model inference result rows per "results" property of
+      htmengine/runtime/json_schema/model_inference_results_msg_schema.json
+    :type rows: Sequence of dicts
+    """
+    hourToMaxScore = self._computeHourlyMaxScores(rows)
     for ts, score in sorted(hourToMaxScore.iteritems()):
-      score = FIXED_DYNAMODB_CONTEXT.create_decimal_from_float(score)
-      dateHour = ts.strftime("%Y-%m-%dT%H")
-
-      data = {
-          "instance_id": {"S": instanceName},
-          "date_hour": {"S": dateHour},
-          "date": {"S": ts.strftime("%Y-%m-%d")},
-          "hour": {"S": ts.strftime("%H")},
-          "anomaly_score": {"M": {metricType: {"N": str(score)}}},
-      }
-      # Validate the data fields against the schema
-      InstanceDataHourlyDynamoDBDefinition().Item(**data)
-
-      # First try a conditional update for the anomaly score for this metric
-      updateKey = {"instance_id": data["instance_id"],
-                   "date_hour": data["date_hour"]}
-      anomalyScoreMetric = "anomaly_score.%s" % metricType
-      updateCondition = ("attribute_not_exists(%(asm)s) or "
-                         "%(asm)s < :value" % {"asm": anomalyScoreMetric})
-      updateValues = {":value": {"N": str(score)}}
-      updateExpression = "SET %s = :value" % anomalyScoreMetric
-
-      @retryOnTransientDynamoDBError(g_log)
-      def updateItemWithRetries():
-        self.dynamodb.update_item(self._instance_data_hourly.table_name,
-                                  key=updateKey,
-                                  update_expression=updateExpression,
-                                  condition_expression=updateCondition,
-                                  expression_attribute_values=updateValues)
-
-      try:
-        updateItemWithRetries()
-      except ResourceNotFoundException:
-        # There is no row yet, so continue on to PutItem
-        pass
-      except ValidationException:
-        # It's OK, let's continue and try the PutItem
-        pass
-      except ConditionalCheckFailedException:
-        # The existing value is larger so we are done
-        continue
-      except Exception:
-        g_log.exception("update_item failed: table=%s; updateKey=%s; "
-                        "update=%s; condition=%s; values=%s",
-                        self._instance_data_hourly.table_name, updateKey,
-                        updateExpression, updateCondition, updateValues)
-        raise
-      else:
-        # There was no exception, the update succeeded, we are done
-        continue
+      self._putInstanceDataHourlyScore(instanceName, metricType, ts, score)
 
-      # If the UpdateItem failed with ResourceNotFoundException, put the row
-      # and continue to next iteration of the loop
-
-      putCondition = "attribute_not_exists(instance_id)"
-
-      @retryOnTransientDynamoDBError(g_log)
-      def putItemWithRetries(item, condition):
-        self.dynamodb.put_item(
-          self._instance_data_hourly.table_name,
-          item=item,
-          condition_expression=condition)
-
-      try:
-        putItemWithRetries(data, putCondition)
-      except ConditionalCheckFailedException:
-        # No problem, row already exists!
-        pass
-      except Exception:
-        g_log.exception("put_item failed: table=%s; condition=%s; item=%s",
-                        self._instance_data_hourly.table_name, putCondition,
-                        data)
-        raise
-      else:
-        # There was no exception, the put succeeded, we are done
-        continue
 
-      # In the case that a parallel process beat us to it
-      try:
-        updateItemWithRetries()
-      except ConditionalCheckFailedException:
-        # The existing value is larger so we are done
-        continue
-      except Exception:
-        g_log.exception("update_item failed: table=%s; updateKey=%s; "
-                        "update=%s; condition=%s; values=%s",
-                        self._instance_data_hourly.table_name, updateKey,
-                        updateExpression, updateCondition, updateValues)
-        raise
+  def _putInstanceDataHourlyScore(self, instanceName, metricType, ts, score):
+    """ Save the anomaly score of a metric for an hour to the
+    `taurus.data.instance_data_hourly` dynamodb table, unless a higher score is
+    already saved.
 
+    :param str instanceName: name of the instance
+    :param str metricType: the metric type identifier
+    :param datetime ts: the hour, as a datetime truncated to the hour
+    :param float score: maximum anomaly score of the metric in that hour
+    """
+    score = FIXED_DYNAMODB_CONTEXT.create_decimal_from_float(score)
+    dateHour = ts.strftime("%Y-%m-%dT%H")
+
+    data = {
+        "instance_id": {"S": instanceName},
+        "date_hour": {"S": dateHour},
+        "date": {"S": ts.strftime("%Y-%m-%d")},
+        "hour": {"S": ts.strftime("%H")},
+        "anomaly_score": {"M": {metricType: {"N": str(score)}}},
+    }
+    # Validate the data fields against the schema
+    InstanceDataHourlyDynamoDBDefinition().Item(**data)
+
+    # First try a conditional update for the anomaly score for this metric
+    updateKey = {"instance_id": data["instance_id"],
+                 "date_hour": data["date_hour"]}
+    anomalyScoreMetric = "anomaly_score.%s" % metricType
+    updateCondition = ("attribute_not_exists(%(asm)s) or "
+                       "%(asm)s < :value" % {"asm": anomalyScoreMetric})
+    updateValues = {":value": {"N": str(score)}}
+    updateExpression = "SET %s = :value" % anomalyScoreMetric
+
+    @retryOnTransientDynamoDBError(g_log)
+    def updateItemWithRetries():
+      self.dynamodb.update_item(self._instance_data_hourly.table_name,
+                                key=updateKey,
+                                update_expression=updateExpression,
+                                condition_expression=updateCondition,
+                                expression_attribute_values=updateValues)
 
+    try:
+      updateItemWithRetries()
+    except ResourceNotFoundException:
+      # There is no row yet, so continue on to PutItem
+      pass
+    except ValidationException:
+      # It's OK, let's continue and try the PutItem
+      pass
+    except ConditionalCheckFailedException:
+      # The existing value is larger so we are done
+      return
+    except Exception:
+      g_log.exception("update_item failed: table=%s; updateKey=%s; "
+                      "update=%s; condition=%s; values=%s",
+                      self._instance_data_hourly.table_name, updateKey,
+                      updateExpression, updateCondition, updateValues)
+      raise
+    else:
+      # There was no exception, the update succeeded, we are done
+      return
+
+    # If the UpdateItem failed with ResourceNotFoundException, put the row
+
+    putCondition = "attribute_not_exists(instance_id)"
+
+    @retryOnTransientDynamoDBError(g_log)
+    def putItemWithRetries(item, condition):
+      self.dynamodb.put_item(
+        self._instance_data_hourly.table_name,
+        item=item,
+        condition_expression=condition)
+
+    try:
+      putItemWithRetries(data, putCondition)
+    except ConditionalCheckFailedException:
+      # No problem, row already exists!
+      pass
+    except Exception:
+      g_log.exception("put_item failed: table=%s; condition=%s; item=%s",
+                      self._instance_data_hourly.table_name, putCondition,
+                      data)
+      raise
+    else:
+      # There was no exception, the put succeeded, we are done
+      return
+
+    # In the case that a parallel process beat us to it
+    try:
+      updateItemWithRetries()
+    except ConditionalCheckFailedException:
+      # The existing value is larger so we are done
+      return
+    except Exception:
+      g_log.exception("update_item failed: table=%s; updateKey=%s; "
+                      "update=%s; condition=%s; values=%s",
+                      self._instance_data_hourly.table_name, updateKey,
+                      updateExpression, updateCondition, updateValues)
+      raise
 
-  def _handleModelInferenceResults(self, body):
-    """ Model results batch handler. Publishes metric data to DynamoDB for a
-    given model inference results batch pulled off of the `dynamodb` queue.
+
+  def _decodeModelInferenceResults(self, body):
+    """ Deserialize and validate a model inference results batch pulled off of
+    the `dynamodb` queue.
 
     :param body: Serialized message payload; the message is compliant with
       htmengine/runtime/json_schema/model_inference_results_msg_schema.json.
     :type body: str
+    :returns: (metricId, instanceName, metricType, rows) tuple, where rows are
+      the model inference result rows; None if the batch is not to be
+      published
     """
     try:
       batch = AnomalyService.deserializeModelResult(body)
@@ -421,7 +486,7 @@ class DynamoDBService(object):
     if not batch["results"]:
       g_log.error("Empty results in model inference results batch; model=%s",
                   metricId)
-      return
+      return None
 
     lastRow = batch["results"][-1]
     if (datetime.utcfromtimestamp(lastRow["ts"]) <
@@ -429,7 +494,7 @@ class DynamoDBService(object):
          timedelta(days=self._FRESH_DATA_THRESHOLD_DAYS))):
       g_log.info("Dropping stale result batch from model=%s; first=%s; last=%s",
                  metricId, batch["results"][0], lastRow)
-      return
+      return None
 
     instanceName = batch["metric"]["resource"]
 
@@ -449,21 +514,36 @@ class DynamoDBService(object):
     if not metricType:
       g_log.warning("Missing value for metricType, uid=%s, name=%s",
                     metricId, metricName)
-      return
+      return None
 
     if not metricTypeName:
       g_log.warning("Missing value for metricTypeName, uid=%s, name=%s",
                     metricId, metricName)
-      return
+      return None
 
     if not symbol:
       g_log.warning("Missing value for symbol, uid=%s, name=%s",
                     metricId, metricName)
+      return None
+
+    return metricId, instanceName, metricType, batch["results"]
+
+
+  def _handleModelInferenceResults(self, body):
+    """ Model results batch handler. Publishes metric data to DynamoDB for a
+    given model inference results batch pulled off of the `dynamodb` queue.
+
+    :param body: Serialized message payload; the message is compliant with
+      htmengine/runtime/json_schema/model_inference_results_msg_schema.json.
+    :type body: str
+    """
+    decoded = self._decodeModelInferenceResults(body)
+    if decoded is None:
       return
 
-    self._publishMetricData(metricId, batch["results"])
-    self._publishInstanceDataHourly(instanceName, metricType,
-                                    batch["results"])
+    metricId, instanceName, metricType, rows = decoded
+    self._publishMetricData(metricId, rows)
+    self._publishInstanceDataHourly(instanceName, metricType, rows)
 
 
   def _handleNonMetricTweetData(self, body):
@@ -526,14 +606,67 @@ class DynamoDBService(object):
 
 
 
-  def messageHandler(self, message):
-    """ Inspect all inbound model results and non-metric data.  Cache in
-    DynamoDB for consumption by mobile client.
+  def _prepareMessageWrites(self, message):
+    """ Decode an inbound message into the writes needed to cache it in
+    DynamoDB, without performing them.
 
     We will key off of routing key to determine specific handler for inbound
     message.  If routing key is `None`, attempt to decode message using
     `AnomalyService.deserializeModelResult()`.
 
+    Model inference results are fully decoded and converted here, so that only
+    the DynamoDB writes are left to the caller.  Their writes are keyed by
+    metric uid to preserve the per-metric order of writes when they are
+    executed concurrently by `DynamoDBWritePipeline`.
+
+    :param amqp.messages.ConsumerMessage message: see `messageHandler()`
+    :returns: sequence of MetricDataWrite and CallableWrite tasks
+    """
+    if message.methodInfo.routingKey == "taurus.data.non-metric.twitter":
+      return [CallableWrite(partitionKey="tweets",
+                            fn=partial(self._handleNonMetricTweetData,
+                                       message.body))]
+    elif message.methodInfo.routingKey is None:
+      g_log.warning("Unrecognized routing key.")
+      return []
+
+    dataType = (message.properties.headers.get("dataType")
+                if message.properties.headers else None)
+    if not dataType:
+      decoded = self._decodeModelInferenceResults(message.body)
+      if decoded is None:
+        return []
+
+      metricId, instanceName, metricType, rows = decoded
+      return [MetricDataWrite(
+        partitionKey=metricId,
+        items=self._convertMetricDataRows(metricId, rows),
+        hourlyScores=[
+          (instanceName, metricType, ts, score)
+          for ts, score in self._computeHourlyMaxScores(rows).iteritems()])]
+    elif dataType == "model-cmd-result":
+      return [CallableWrite(partitionKey="model-cmd-result",
+                            fn=partial(self._handleModelCommandResult,
+                                       message.body))]
+    else:
+      g_log.warning("Unexpected message header dataType=%s", dataType)
+      return []
+
+
+  def _executeMessageWrite(self, task):
+    """ Perform a write prepared by `_prepareMessageWrites()` """
+    if isinstance(task, MetricDataWrite):
+      self._writeMetricDataItems(task.items)
+      for instanceName, metricType, ts, score in sorted(task.hourlyScores):
+        self._putInstanceDataHourlyScore(instanceName, metricType, ts, score)
+    else:
+      task.fn()
+
+
+  def messageHandler(self, message):
+    """ Inspect all inbound model results and non-metric data.  Cache in
+    DynamoDB for consumption by mobile client, then ack the message.
+
     Tweet data must have routing key of "taurus.metric_data.tweets".
 
     :param amqp.messages.ConsumerMessage message: ``message.body`` is one of:
@@ -550,19 +683,8 @@ class DynamoDBService(object):
           objects, with each object formatted per
           ``taurus_engine/metric_collectors/twitterdirect/tweet_export_schema.json``
     """
-    if message.methodInfo.routingKey == "taurus.data.non-metric.twitter":
-      self._handleNonMetricTweetData(message.body)
-    elif message.methodInfo.routingKey is None:
-      g_log.warning("Unrecognized routing key.")
-    else:
-      dataType = (message.properties.headers.get("dataType")
-                  if message.properties.headers else None)
-      if not dataType:
-        self._handleModelInferenceResults(message.body)
-      elif dataType == "model-cmd-result":
-        self._handleModelCommandResult(message.body)
-      else:
-        g_log.warning("Unexpected message header dataType=%s", dataType)
+    for task in self._prepareMessageWrites(message):
+      self._executeMessageWrite(task)
 
     message.ack()
 
@@ -607,7 +729,44 @@ class DynamoDBService(object):
                                              # words.
 
 
+  def _createInstanceDataHourlyCache(self):
+    """ :returns: an InstanceDataHourlyCache that writes back with this
+    service's connection
+    """
+    return InstanceDataHourlyCache(
+      writeScore=self._putInstanceDataHourlyScore,
+      maxStalenessSec=taurus_engine.config.getfloat(
+        "dynamodb", "instance_data_hourly_max_staleness_sec"))
+
+
+  def _createWritePipeline(self, instanceDataHourlyCache):
+    """ :returns: a DynamoDBWritePipeline that writes with this service's
+    connection and tables; boto's connection pool is thread-safe
+
+    :param InstanceDataHourlyCache instanceDataHourlyCache: cache through
+      which to save hourly anomaly scores
+    """
+    return DynamoDBWritePipeline(
+      numWorkers=taurus_engine.config.getint("dynamodb", "num_writer_threads"),
+      writeMetricDataItems=self._writeMetricDataItems,
+      writeInstanceDataHourlyScore=instanceDataHourlyCache.update)
+
+
   def run(self):
+    """ Consume the `dynamodb` queue, decoding messages on this thread and
+    writing them to DynamoDB concurrently with `DynamoDBWritePipeline`.
+
+    Messages are acked from this thread as their writes land.  Before blocking
+    for the next message, all in-flight writes are drained and acked: the
+    broker delivers at most ``prefetch_count`` unacked messages, so waiting
+    with messages left unacked could stall consumption.
+
+    Hourly anomaly scores are saved through `InstanceDataHourlyCache`, which
+    writes them back at most ``instance_data_hourly_max_staleness_sec`` after
+    they are raised. NOTE: unlike metric data, their messages may be acked
+    before they are written, so a crash may lose up to that many seconds of
+    hourly score increases.
+    """
     g_log.info("Running")
 
     def _configChannel(amqpClient):
@@ -615,6 +774,11 @@ class DynamoDBService(object):
           prefetchCount=taurus_engine.config.getint("dynamodb",
                                                     "prefetch_count"))
 
+    instanceDataHourlyCache = self._createInstanceDataHourlyCache()
+    instanceDataHourlyCache.start()
+    writePipeline = self._createWritePipeline(instanceDataHourlyCache)
+    writePipeline.start()
+
     try:
       # Open connection to rabbitmq
       with amqp.synchronous_amqp_client.SynchronousAmqpClient(
@@ -628,7 +792,8 @@ class DynamoDBService(object):
         # Start consuming messages
         for evt in amqpClient.readEvents():
           if isinstance(evt, amqp.messages.ConsumerMessage):
-            self.messageHandler(evt)
+            writePipeline.submit(evt, self._prepareMessageWrites(evt))
+            writePipeline.ackCompleted()
           elif isinstance(evt, amqp.consumer.ConsumerCancellation):
             # Bad news: this likely means that our queue was deleted externally
             msg = "Consumer cancelled by broker: %r (%r)" % (evt, consumer)
@@ -637,6 +802,10 @@ class DynamoDBService(object):
           else:
             g_log.warning("Unexpected amqp event=%r", evt)
 
+          if not amqpClient.hasEvent():
+            # Next readEvents() iteration will block waiting for the broker
+            writePipeline.drain()
+
     except amqp.exceptions.AmqpConnectionError:
       g_log.exception("RabbitMQ connection failed")
       raise
@@ -650,6 +819,8 @@ class DynamoDBService(object):
       g_log.info("Stopping Taurus DynamoDB Service", exc_info=True)
     finally:
       g_log.info("Stopping Taurus DynamoDB Service")
+      writePipeline.stop()
+      instanceDataHourlyCache.stop()
 
 
 
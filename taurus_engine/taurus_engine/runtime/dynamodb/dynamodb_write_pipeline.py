@@ -0,0 +1,324 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+""" Parallel DynamoDB write pipeline used by DynamoDBService.
+
+Messages are decoded on the AMQP reader thread into write tasks, which are
+executed by a pool of worker threads. Tasks are partitioned among the workers
+by key (the metric uid for model inference results), so the writes of any given
+metric are applied in the order in which their messages were received.
+
+Each worker coalesces the `metric_data` items of the tasks that are queued up
+for it, across messages, into full 25-item batch writes, and merges their
+`instance_data_hourly` updates, keeping the highest anomaly score per instance,
+metric type and hour.
+
+A message is acked only after all the writes of all its tasks have landed.
+Since the AMQP client is not thread-safe, acks are issued from the reader
+thread: see `ackCompleted()` and `drain()`.
+"""
+
+from collections import namedtuple, OrderedDict
+import Queue
+import threading
+
+from taurus_engine import taurus_logging
+
+
+
+g_log = taurus_logging.getExtendedLogger(__name__)
+
+
+
+# Write task carrying model inference results of a single metric
+#
+# partitionKey: metric uid
+# items: sequence of metric_data item dicts
+# hourlyScores: sequence of (instanceName, metricType, hour, score) tuples,
+#   where hour is a datetime truncated to the hour and score is the maximum
+#   anomaly score of the metric in that hour
+MetricDataWrite = namedtuple("MetricDataWrite",
+                             "partitionKey items hourlyScores")
+
+
+# Write task that is executed as is
+#
+# partitionKey: key for assigning the task to a worker
+# fn: function to call without arguments
+CallableWrite = namedtuple("CallableWrite", "partitionKey fn")
+
+
+
+class WritePipelineError(Exception):
+  """ A worker of the write pipeline failed; the pipeline is no longer usable
+  """
+  pass
+
+
+
+class _PendingMessage(object):
+  """ A message whose write tasks haven't all completed yet """
+
+  __slots__ = ("message", "numTasksRemaining")
+
+  def __init__(self, message, numTasks):
+    self.message = message
+    self.numTasksRemaining = numTasks
+
+
+
+class DynamoDBWritePipeline(object):
+  """ Executes write tasks on a pool of worker threads, partitioned by key.
+
+  ::
+
+      pipeline = DynamoDBWritePipeline(numWorkers=4,
+                                       writeMetricDataItems=...,
+                                       writeInstanceDataHourlyScore=...)
+      pipeline.start()
+      try:
+        for message in messages:
+          pipeline.submit(message, decodeWriteTasks(message))
+          pipeline.ackCompleted()
+        pipeline.drain()
+      finally:
+        pipeline.stop()
+  """
+
+  # DynamoDB's maximum batch write size
+  BATCH_WRITE_SIZE = 25
+
+  # Maximum number of metric_data items a worker coalesces before writing them
+  # and completing the corresponding tasks
+  _MAX_COALESCED_ITEMS = 10 * BATCH_WRITE_SIZE
+
+  _STOP = object()
+
+
+  def __init__(self, numWorkers, writeMetricDataItems,
+               writeInstanceDataHourlyScore):
+    """
+    :param int numWorkers: number of worker threads
+    :param writeMetricDataItems: function that writes a sequence of
+      metric_data item dicts with batch writes; called from worker threads
+    :param writeInstanceDataHourlyScore: function that saves an hourly anomaly
+      score to instance_data_hourly, given (instanceName, metricType, hour,
+      score); called from worker threads
+    """
+    if numWorkers < 1:
+      raise ValueError("numWorkers must be positive")
+
+    self._numWorkers = numWorkers
+    self._writeMetricDataItems = writeMetricDataItems
+    self._writeInstanceDataHourlyScore = writeInstanceDataHourlyScore
+
+    self._workerQueues = [Queue.Queue() for _ in xrange(numWorkers)]
+    self._workers = []
+    self._completedQueue = Queue.Queue()
+    self._lock = threading.Lock()
+    self._failure = None
+
+    # Number of submitted messages not yet acked; only accessed by the
+    # submitting thread
+    self._numPending = 0
+
+
+  @property
+  def numPending(self):
+    """ Number of submitted messages that haven't been acked yet """
+    return self._numPending
+
+
+  def start(self):
+    for i, workerQueue in enumerate(self._workerQueues):
+      worker = threading.Thread(target=self._runWorker,
+                                args=(workerQueue,),
+                                name="DynamoDBWriter-%d" % (i,))
+      worker.setDaemon(True)
+      worker.start()
+      self._workers.append(worker)
+
+
+  def stop(self):
+    """ Stop the workers after they complete the tasks already submitted """
+    for workerQueue in self._workerQueues:
+      workerQueue.put(self._STOP)
+
+    for worker in self._workers:
+      worker.join()
+
+    del self._workers[:]
+
+
+  def submit(self, message, tasks):
+    """ Submit the write tasks of a message. Must be called from the thread
+    that acks messages.
+
+    :param message: message to ack once all its tasks complete; an object with
+      an `ack()` method, such as `nta.utils.amqp.messages.ConsumerMessage`
+    :param tasks: sequence of MetricDataWrite and CallableWrite tasks; the
+      message is acked right away if there are none
+    :raises WritePipelineError: if a worker failed
+    """
+    self._checkFailure()
+
+    if not tasks:
+      message.ack()
+      return
+
+    pending = _PendingMessage(message, len(tasks))
+    self._numPending += 1
+
+    for task in tasks:
+      workerIndex = hash(task.partitionKey) % self._numWorkers
+      self._workerQueues[workerIndex].put((task, pending))
+
+
+  def ackCompleted(self):
+    """ Ack the messages whose writes have all landed, without blocking
+
+    :raises WritePipelineError: if a worker failed
+    """
+    while True:
+      try:
+        pending = self._completedQueue.get_nowait()
+      except Queue.Empty:
+        break
+      self._ack(pending)
+
+    self._checkFailure()
+
+
+  def drain(self):
+    """ Wait for the writes of all submitted messages to land and ack them
+
+    :raises WritePipelineError: if a worker failed
+    """
+    while self._numPending:
+      self._checkFailure()
+      try:
+        pending = self._completedQueue.get(timeout=0.5)
+      except Queue.Empty:
+        continue
+      self._ack(pending)
+
+    self._checkFailure()
+
+
+  def _ack(self, pending):
+    pending.message.ack()
+    self._numPending -= 1
+
+
+  def _checkFailure(self):
+    with self._lock:
+      failure = self._failure
+
+    if failure is not None:
+      raise WritePipelineError("DynamoDB writer failed: %r" % (failure,))
+
+
+  def _runWorker(self, workerQueue):
+    while True:
+      entry = workerQueue.get()
+      if entry is self._STOP:
+        return
+
+      # Coalesce the tasks already queued up for this worker
+      entries = [entry]
+      numItems = len(getattr(entry[0], "items", ()))
+      stop = False
+      while numItems < self._MAX_COALESCED_ITEMS:
+        try:
+          entry = workerQueue.get_nowait()
+        except Queue.Empty:
+          break
+        if entry is self._STOP:
+          stop = True
+          break
+        entries.append(entry)
+        numItems += len(getattr(entry[0], "items", ()))
+
+      try:
+        self._executeEntries(entries)
+      except Exception as e:
+        g_log.exception("DynamoDB write failed")
+        with self._lock:
+          self._failure = e
+        return
+
+      if stop:
+        return
+
+
+  def _executeEntries(self, entries):
+    """ Execute a sequence of (task, pendingMessage) entries in order,
+    coalescing the writes of consecutive MetricDataWrite tasks
+    """
+    metricDataEntries = []
+    for task, pending in entries:
+      if isinstance(task, MetricDataWrite):
+        metricDataEntries.append((task, pending))
+        continue
+
+      self._executeMetricDataEntries(metricDataEntries)
+      metricDataEntries = []
+
+      task.fn()
+      self._completeTask(pending)
+
+    self._executeMetricDataEntries(metricDataEntries)
+
+
+  def _executeMetricDataEntries(self, entries):
+    if not entries:
+      return
+
+    # Later items replace earlier ones with the same key, as they would with
+    # sequential writes; a batch write rejects duplicate keys
+    items = OrderedDict()
+    hourlyScores = {}
+    for task, _ in entries:
+      for item in task.items:
+        items[(item["uid"], item["timestamp"])] = item
+
+      for instanceName, metricType, hour, score in task.hourlyScores:
+        key = (instanceName, metricType, hour)
+        hourlyScores[key] = max(hourlyScores.get(key, score), score)
+
+    if items:
+      self._writeMetricDataItems(items.values())
+
+    for (instanceName, metricType, hour), score in sorted(
+        hourlyScores.iteritems()):
+      self._writeInstanceDataHourlyScore(instanceName, metricType, hour, score)
+
+    for _, pending in entries:
+      self._completeTask(pending)
+
+
+  def _completeTask(self, pending):
+    with self._lock:
+      pending.numTasksRemaining -= 1
+      completed = pending.numTasksRemaining == 0
+
+    if completed:
+      self._completedQueue.put(pending)
@@ -0,0 +1,300 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+""" Write-back cache of the hourly maximum anomaly scores saved to the
+`taurus.data.instance_data_hourly` dynamodb table.
+
+Every model inference results batch of a metric yields a score for the hour
+of its rows, but the saved item only changes when that score exceeds the
+hour's maximum so far. The cache keeps the latest hour of each
+(instance, metricType) series and:
+
+  - drops scores that don't raise the hour's maximum;
+  - holds a raised maximum back until the series rolls over to a later hour,
+    or until it has been pending for ``maxStalenessSec`` (see `start()`), so
+    that successive increases are coalesced into a single write;
+  - writes scores for earlier hours (out-of-order results) through right away.
+
+Scores whose writes fail are kept and retried by the next flush, including
+those of hours that are no longer cached.
+
+NOTE: `update()` returns before a raised score is written, so the message
+that carried the score may be acked while the score is only held in memory.
+Such scores are lost if the process dies before they are flushed: the crash
+loss window is ``maxStalenessSec``, plus the duration of failing writes that
+are being retried. ``maxStalenessSec`` also bounds how stale the mobile
+client's view of an hour may be.
+"""
+
+from collections import namedtuple
+import threading
+import time
+
+from taurus_engine import taurus_logging
+
+
+
+g_log = taurus_logging.getExtendedLogger(__name__)
+
+
+
+# InstanceDataHourlyCache counters
+#
+# numUpdates: number of scores passed to `update()`
+# numWrites: number of scores written to dynamodb
+# numWritesAvoided: number of scores that were dropped or superseded by a
+#   higher score before being written
+InstanceDataHourlyCacheStats = namedtuple(
+  "InstanceDataHourlyCacheStats",
+  "numUpdates numWrites numWritesAvoided")
+
+
+
+class _SeriesEntry(object):
+  """ Cached state of the latest hour of an (instance, metricType) series """
+
+  __slots__ = ("hour", "savedScore", "pendingScore", "pendingSince")
+
+  def __init__(self, hour):
+    # datetime truncated to the hour
+    self.hour = hour
+    # Highest score written, or known to be superseded, in dynamodb
+    self.savedScore = None
+    # Score to write; None if there is nothing to write
+    self.pendingScore = None
+    # Time at which pendingScore became pending
+    self.pendingSince = None
+
+
+
+class InstanceDataHourlyCache(object):
+  """ Write-back cache of hourly maximum anomaly scores. Thread-safe.
+
+  ::
+
+      cache = InstanceDataHourlyCache(writeScore=service.putScore,
+                                      maxStalenessSec=30)
+      cache.start()
+      try:
+        cache.update("AAPL", "StockVolume", hour, 0.7)
+        ...
+      finally:
+        cache.stop()
+  """
+
+  # Interval between logging the cache's counters
+  _STATS_LOG_INTERVAL_SEC = 600
+
+
+  def __init__(self, writeScore, maxStalenessSec, clock=time.time):
+    """
+    :param writeScore: function that saves the score of a metric for an hour,
+      unless a higher score is already saved, given (instanceName, metricType,
+      hour, score); called without holding the cache's lock, from the threads
+      that call `update()`, `flush()` and from the background flusher
+    :param float maxStalenessSec: maximum time that a raised score is held
+      back before it is written
+    :param clock: function returning the current time in seconds
+    """
+    self._writeScore = writeScore
+    self._maxStalenessSec = maxStalenessSec
+    self._clock = clock
+
+    self._lock = threading.Lock()
+    self._series = {}
+
+    # Scores of failed writes for hours that are no longer cached, by
+    # (seriesKey, hour); retried by the next flush
+    self._detachedScores = {}
+
+    self._numUpdates = 0
+    self._numWrites = 0
+    self._numWritesAvoided = 0
+
+    self._stopEvent = threading.Event()
+    self._flusher = None
+
+
+  def getStats(self):
+    """ :returns: the cache's counters
+    :rtype: InstanceDataHourlyCacheStats
+    """
+    with self._lock:
+      return InstanceDataHourlyCacheStats(
+        numUpdates=self._numUpdates,
+        numWrites=self._numWrites,
+        numWritesAvoided=self._numWritesAvoided)
+
+
+  def start(self):
+    """ Start the background thread that writes scores that have been pending
+    for ``maxStalenessSec``
+    """
+    self._stopEvent.clear()
+    self._flusher = threading.Thread(target=self._runFlusher,
+                                     name="InstanceDataHourlyFlusher")
+    self._flusher.setDaemon(True)
+    self._flusher.start()
+
+
+  def stop(self):
+    """ Stop the background flusher and write all pending scores """
+    if self._flusher is not None:
+      self._stopEvent.set()
+      self._flusher.join()
+      self._flusher = None
+
+    self.flush()
+    g_log.info("instance_data_hourly cache: %r", self.getStats())
+
+
+  def update(self, instanceName, metricType, hour, score):
+    """ Record the maximum anomaly score of a metric for an hour
+
+    :param str instanceName: name of the instance
+    :param str metricType: the metric type identifier
+    :param datetime hour: the hour, as a datetime truncated to the hour
+    :param float score: maximum anomaly score of the metric in that hour
+    """
+    writes = []
+
+    with self._lock:
+      self._numUpdates += 1
+
+      seriesKey = (instanceName, metricType)
+      entry = self._series.get(seriesKey)
+
+      if entry is not None and hour < entry.hour:
+        # Out-of-order result for an hour that is no longer cached
+        writes.append((seriesKey, hour, score, None))
+
+      else:
+        if entry is None or hour > entry.hour:
+          # Hour rollover: write back the previous hour's pending score
+          if entry is not None and entry.pendingScore is not None:
+            writes.append((seriesKey, entry.hour, entry.pendingScore, None))
+          entry = self._series[seriesKey] = _SeriesEntry(hour)
+
+        if score <= max(entry.savedScore, entry.pendingScore):
+          self._numWritesAvoided += 1
+        else:
+          if entry.pendingScore is None:
+            entry.pendingSince = self._clock()
+          else:
+            # Superseded before being written
+            self._numWritesAvoided += 1
+          entry.pendingScore = score
+
+    self._write(writes)
+
+
+  def flush(self):
+    """ Write all pending scores """
+    self._write(self._takePending(maxPendingSince=None))
+
+
+  def flushStale(self):
+    """ Write the scores that have been pending for ``maxStalenessSec`` """
+    self._write(self._takePending(
+      maxPendingSince=self._clock() - self._maxStalenessSec))
+
+
+  def _takePending(self, maxPendingSince):
+    """ Mark pending scores as saved, returning the writes that save them
+
+    :param maxPendingSince: only take scores pending since this time or
+      earlier; None to take all pending scores. Scores of failed writes for
+      hours that are no longer cached are always taken.
+    :returns: sequence of (seriesKey, hour, score, entry) writes
+    """
+    writes = []
+    with self._lock:
+      for (seriesKey, hour), score in self._detachedScores.iteritems():
+        writes.append((seriesKey, hour, score, None))
+      self._detachedScores.clear()
+
+      for seriesKey, entry in self._series.iteritems():
+        if entry.pendingScore is None:
+          continue
+        if maxPendingSince is not None and entry.pendingSince > maxPendingSince:
+          continue
+
+        writes.append((seriesKey, entry.hour, entry.pendingScore, entry))
+        entry.savedScore = entry.pendingScore
+        entry.pendingScore = None
+        entry.pendingSince = None
+
+    return writes
+
+
+  def _write(self, writes):
+    """ Perform writes; the scores of failed writes become pending again, so
+    that a later flush retries them
+
+    :param writes: sequence of (seriesKey, hour, score, entry) writes, where
+      entry is the _SeriesEntry that the score was taken from, if any
+    """
+    for i, (seriesKey, hour, score, entry) in enumerate(writes):
+      instanceName, metricType = seriesKey
+      try:
+        self._writeScore(instanceName, metricType, hour, score)
+      except Exception:
+        self._restorePending(writes[i:])
+        raise
+
+      with self._lock:
+        self._numWrites += 1
+
+
+  def _restorePending(self, writes):
+    with self._lock:
+      for seriesKey, hour, score, entry in writes:
+        current = self._series.get(seriesKey)
+        if current is not None and current.hour == hour:
+          entry = current
+        elif entry is None or current is not entry:
+          # The hour is no longer cached, e.g., a rollover or out-of-order
+          # write; its message may already have been acked, so keep the score
+          # for the next flush
+          key = (seriesKey, hour)
+          self._detachedScores[key] = max(self._detachedScores.get(key),
+                                          score)
+          continue
+
+        if score > entry.pendingScore:
+          entry.pendingScore = score
+          entry.pendingSince = self._clock()
+
+
+  def _runFlusher(self):
+    flushIntervalSec = self._maxStalenessSec / 2.0
+    nextStatsLogTime = self._clock() + self._STATS_LOG_INTERVAL_SEC
+
+    while not self._stopEvent.wait(flushIntervalSec):
+      try:
+        self.flushStale()
+      except Exception:
+        # The failed scores are pending again and will be retried
+        g_log.exception("Failed to write stale instance_data_hourly scores")
+
+      if self._clock() >= nextStatsLogTime:
+        g_log.info("instance_data_hourly cache: %r", self.getStats())
+        nextStatsLogTime = self._clock() + self._STATS_LOG_INTERVAL_SEC
@@ -0,0 +1,586 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+""" Resumable backfill of metric data to the model results exchange.
+
+`MetricDataBackfill` synthesizes the "defineModel" command result and the model
+inference result messages of the AnomalyService from the metric data in the
+repository, so that the dynamodb service backfills older data. The work is
+split by metric uid among worker threads. Each worker pages through the rows of
+a metric by rowid (keyset pagination), publishes them in batches subject to a
+shared rate limit, and records the last published rowid of the metric in a
+checkpoint file after each batch, so that an interrupted backfill resumes where
+it stopped instead of starting over. Since a batch may be published again after
+a crash, publishing is at-least-once; the dynamodb service's writes are
+idempotent.
+
+`MetricDataBackfill.verify()` compares the per-metric row counts of the
+repository with those of the destination, e.g. `DynamoDBMetricDataCounter`.
+"""
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+import json
+import os
+import Queue
+import tempfile
+import threading
+import time
+
+from boto.dynamodb2.table import Table
+import sqlalchemy as sql
+
+from nta.utils import amqp
+from nta.utils.date_time_utils import epochFromNaiveUTCDatetime
+from nta.utils.dynamodb_utils import retryOnTransientDynamoDBError
+from nta.utils.message_bus_connector import MessageProperties
+from nta.utils.sqlalchemy_utils import retryOnTransientErrors
+
+from htmengine import htmengineerrno
+from htmengine.runtime.anomaly_service import AnomalyService
+
+from taurus_engine import config, repository, taurus_logging
+from taurus_engine.repository import schema
+from taurus_engine.runtime.dynamodb.definitions import (
+  MetricDataDynamoDBDefinition)
+
+
+
+g_log = taurus_logging.getExtendedLogger(__name__)
+
+
+
+DEFAULT_NUM_WORKERS = 4
+
+# Max number of rows per model inference results message
+DEFAULT_BATCH_SIZE = 200
+
+# Max number of rows fetched from the repository per query
+DEFAULT_PAGE_SIZE = 2000
+
+# Max number of messages published per second by all workers together
+DEFAULT_MAX_MESSAGES_PER_SEC = 50
+
+# Matches the dynamodb service's cutoff for stale model inference results
+DEFAULT_WINDOW_DAYS = 14
+
+
+
+# Progress of the backfill of one metric, as recorded in the checkpoint file
+#
+# lastRowid: rowid of the last published row; -1 if none
+# numRows: number of rows published
+# done: True if all the metric's rows have been published
+MetricCheckpoint = namedtuple("MetricCheckpoint", "lastRowid numRows done")
+
+
+# Result of MetricDataBackfill.run()
+#
+# numMetrics: number of metrics backfilled during this run
+# numRows: number of rows published during this run
+# numMessages: number of messages published during this run
+BackfillStats = namedtuple("BackfillStats", "numMetrics numRows numMessages")
+
+
+# Metric whose row count differs between the repository and the destination
+#
+# uid: metric uid
+# sourceCount: number of distinct row timestamps in the repository
+# destinationCount: number of rows at the destination
+CountMismatch = namedtuple("CountMismatch", "uid sourceCount destinationCount")
+
+
+
+class BackfillCheckpoint(object):
+  """ Append-only file of per-metric backfill progress; the last record of a
+  metric wins. The file starts with a header record holding the start of the
+  backfill window, so that a resumed backfill covers the same rows.
+  """
+
+  _TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+  def __init__(self, path, fromTimestamp):
+    """ Open the checkpoint file, creating it if needed, and compact it
+
+    :param str path: path of the checkpoint file
+    :param datetime fromTimestamp: naive UTC start of the backfill window; only
+      used if the file doesn't exist yet
+    """
+    self._path = path
+    self._lock = threading.Lock()
+    self._metrics = {}
+
+    if os.path.exists(path):
+      self._load()
+    else:
+      self.fromTimestamp = fromTimestamp.replace(microsecond=0)
+
+    # Rewrite the file with only the latest record of each metric
+    self._rewrite()
+    self._fileObj = open(path, "a")
+
+
+  def _load(self):
+    with open(self._path) as fileObj:
+      header = json.loads(fileObj.readline())
+      self.fromTimestamp = datetime.strptime(header["fromTimestamp"],
+                                             self._TIMESTAMP_FORMAT)
+
+      for line in fileObj:
+        try:
+          record = json.loads(line)
+        except ValueError:
+          # The last line may have been truncated by a crash mid-write
+          g_log.warning("Ignoring malformed checkpoint line=%r", line)
+          continue
+
+        self._metrics[record["uid"]] = MetricCheckpoint(
+          lastRowid=record["lastRowid"],
+          numRows=record["numRows"],
+          done=record["done"])
+
+
+  def _rewrite(self):
+    fd, tempPath = tempfile.mkstemp(dir=os.path.dirname(
+      os.path.abspath(self._path)))
+    with os.fdopen(fd, "w") as fileObj:
+      fileObj.write(json.dumps({
+        "fromTimestamp": self.fromTimestamp.strftime(self._TIMESTAMP_FORMAT)
+      }) + "\n")
+      for uid, checkpoint in self._metrics.iteritems():
+        fileObj.write(self._formatRecord(uid, checkpoint))
+      fileObj.flush()
+      os.fsync(fileObj.fileno())
+    os.rename(tempPath, self._path)
+
+
+  @staticmethod
+  def _formatRecord(uid, checkpoint):
+    return json.dumps(dict(uid=uid, **checkpoint._asdict())) + "\n"
+
+
+  def close(self):
+    self._fileObj.close()
+
+
+  def get(self, uid):
+    """
+    :returns: the metric's MetricCheckpoint; None if there is none
+    """
+    with self._lock:
+      return self._metrics.get(uid)
+
+
+  def getAll(self):
+    """
+    :returns: dict of metric uid -> MetricCheckpoint
+    """
+    with self._lock:
+      return dict(self._metrics)
+
+
+  def update(self, uid, checkpoint):
+    """ Durably record the metric's progress
+
+    :param str uid: metric uid
+    :param MetricCheckpoint checkpoint: the metric's progress
+    """
+    with self._lock:
+      self._fileObj.write(self._formatRecord(uid, checkpoint))
+      self._fileObj.flush()
+      os.fsync(self._fileObj.fileno())
+      self._metrics[uid] = checkpoint
+
+
+
+class _Throttle(object):
+  """ Limits the rate of calls to `wait()` across threads """
+
+  def __init__(self, maxPerSec):
+    self._interval = 1.0 / maxPerSec if maxPerSec else 0
+    self._lock = threading.Lock()
+    self._nextTime = 0
+
+
+  def wait(self):
+    if not self._interval:
+      return
+
+    # Reserve a slot under the lock and sleep outside of it
+    with self._lock:
+      now = time.time()
+      slot = max(now, self._nextTime)
+      self._nextTime = slot + self._interval
+
+    if slot > now:
+      time.sleep(slot - now)
+
+
+
+class DynamoDBMetricDataCounter(object):
+  """ Counts the rows of a metric in the metric_data DynamoDB table """
+
+  def __init__(self, connection):
+    """
+    :param connection: boto DynamoDB connection; e.g.,
+      `DynamoDBService.connectDynamoDB()`
+    """
+    self._table = Table(MetricDataDynamoDBDefinition().tableName,
+                        connection=connection)
+
+
+  def __call__(self, uid, fromTimestamp):
+    """
+    :param str uid: metric uid
+    :param datetime fromTimestamp: naive UTC timestamp of the earliest rows to
+      count
+    :returns: number of rows of the metric at or after fromTimestamp
+    """
+    return retryOnTransientDynamoDBError(g_log)(self._table.query_count)(
+      uid__eq=uid, timestamp__gte=fromTimestamp.isoformat())
+
+
+
+class MetricDataBackfill(object):
+  """ Publishes the repository's metric data of all metrics to the model
+  results exchange with a pool of workers; see module docstring
+  """
+
+  def __init__(self,
+               engine,
+               messageBusFactory,
+               checkpointPath,
+               numWorkers=DEFAULT_NUM_WORKERS,
+               batchSize=DEFAULT_BATCH_SIZE,
+               pageSize=DEFAULT_PAGE_SIZE,
+               maxMessagesPerSec=DEFAULT_MAX_MESSAGES_PER_SEC,
+               windowDays=DEFAULT_WINDOW_DAYS):
+    """
+    :param engine: SQLAlchemy engine of the repository
+    :param messageBusFactory: function that returns a new
+      nta.utils.message_bus_connector.MessageBusConnector context manager; each
+      worker has its own, since they aren't thread-safe
+    :param str checkpointPath: path of the checkpoint file; an existing
+      checkpoint file resumes the backfill that created it
+    :param int numWorkers: number of worker threads
+    :param int batchSize: max number of rows per published message
+    :param int pageSize: max number of rows per repository query
+    :param maxMessagesPerSec: max number of messages published per second by
+      all workers together; 0 for no limit
+    :param int windowDays: number of days of data to backfill; ignored when
+      resuming
+    """
+    if numWorkers < 1:
+      raise ValueError("numWorkers must be positive, but got %r" %
+                       (numWorkers,))
+    if batchSize < 1 or pageSize < 1:
+      raise ValueError("batchSize and pageSize must be positive, but got "
+                       "%r, %r" % (batchSize, pageSize))
+
+    self._engine = engine
+    self._messageBusFactory = messageBusFactory
+    self._numWorkers = numWorkers
+    self._batchSize = batchSize
+    self._pageSize = pageSize
+    self._throttle = _Throttle(maxMessagesPerSec)
+
+    self._checkpoint = BackfillCheckpoint(
+      checkpointPath,
+      fromTimestamp=datetime.utcnow() - timedelta(days=windowDays))
+
+    self._resultsExchange = config.get("metric_streamer",
+                                       "results_exchange_name")
+
+    # Properties for publishing model command results on RabbitMQ exchange
+    # (same as AnomalyService)
+    self._modelCommandResultProperties = MessageProperties(
+      deliveryMode=amqp.constants.AMQPDeliveryModes.PERSISTENT_MESSAGE,
+      headers=dict(dataType="model-cmd-result"))
+
+    # Properties for publishing model inference results on RabbitMQ exchange
+    # (same as AnomalyService)
+    self._modelInferenceResultProperties = MessageProperties(
+      deliveryMode=amqp.constants.AMQPDeliveryModes.PERSISTENT_MESSAGE)
+
+    self._statsLock = threading.Lock()
+    self._numMetrics = 0
+    self._numRows = 0
+    self._numMessages = 0
+
+
+  @property
+  def fromTimestamp(self):
+    """ Naive UTC start of the backfill window """
+    return self._checkpoint.fromTimestamp
+
+
+  def close(self):
+    self._checkpoint.close()
+
+
+  @retryOnTransientErrors
+  def _getMetricIds(self):
+    with self._engine.connect() as conn:
+      return [row.uid for row in conn.execute(
+        sql.select([schema.metric.c.uid]).order_by(schema.metric.c.uid))]
+
+
+  @retryOnTransientErrors
+  def _getMetric(self, uid):
+    with self._engine.connect() as conn:
+      return repository.getMetric(conn, uid)
+
+
+  @retryOnTransientErrors
+  def _getMetricDataPage(self, uid, afterRowid):
+    """
+    :returns: the next page of the metric's scored rows in the backfill window
+      with rowids greater than afterRowid, in rowid order
+    """
+    metricData = schema.metric_data
+    sel = (sql.select([metricData.c.rowid,
+                       metricData.c.timestamp,
+                       metricData.c.metric_value,
+                       metricData.c.raw_anomaly_score,
+                       metricData.c.anomaly_score])
+           .where(metricData.c.uid == uid)
+           .where(metricData.c.rowid > afterRowid)
+           .where(metricData.c.timestamp >= self.fromTimestamp)
+           .where(metricData.c.anomaly_score != None)
+           .order_by(metricData.c.rowid.asc())
+           .limit(self._pageSize))
+
+    with self._engine.connect() as conn:
+      return conn.execute(sel).fetchall()
+
+
+  @retryOnTransientErrors
+  def _getSourceCount(self, uid, fromTimestamp):
+    """
+    :returns: number of distinct timestamps of the metric's scored rows at or
+      after fromTimestamp; the dynamodb service drops rows with duplicate
+      timestamps
+    """
+    metricData = schema.metric_data
+    sel = (sql.select([sql.func.count(sql.distinct(metricData.c.timestamp))])
+           .where(metricData.c.uid == uid)
+           .where(metricData.c.timestamp >= fromTimestamp)
+           .where(metricData.c.anomaly_score != None))
+
+    with self._engine.connect() as conn:
+      return conn.execute(sel).scalar()
+
+
+  def run(self, metricIds=None):
+    """ Backfill the metric data of the given metrics, skipping those that the
+    checkpoint has as done
+
+    :param metricIds: uids of the metrics to backfill; None for all metrics
+    :returns: BackfillStats
+    """
+    if metricIds is None:
+      metricIds = self._getMetricIds()
+
+    self._numMetrics = self._numRows = self._numMessages = 0
+
+    pending = [uid for uid in metricIds
+               if not (self._checkpoint.get(uid) and
+                       self._checkpoint.get(uid).done)]
+
+    g_log.info("Backfilling metric data since %s of %d metrics (%d done per "
+               "checkpoint) with %d workers", self.fromTimestamp, len(pending),
+               len(metricIds) - len(pending), self._numWorkers)
+
+    uidQueue = Queue.Queue()
+    for uid in pending:
+      uidQueue.put(uid)
+
+    errors = []
+
+    def workerMain():
+      try:
+        with self._messageBusFactory() as messageBus:
+          while True:
+            try:
+              uid = uidQueue.get_nowait()
+            except Queue.Empty:
+              return
+            self._backfillMetric(messageBus, uid)
+      except Exception as e:
+        g_log.exception("Backfill worker failed")
+        errors.append(e)
+        # Stop the other workers
+        while True:
+          try:
+            uidQueue.get_nowait()
+          except Queue.Empty:
+            break
+
+    workers = [threading.Thread(target=workerMain,
+                                name="MetricDataBackfill-%d" % (i,))
+               for i in xrange(min(self._numWorkers, len(pending)))]
+    for worker in workers:
+      worker.setDaemon(True)
+      worker.start()
+    for worker in workers:
+      worker.join()
+
+    if errors:
+      # The checkpoint has the progress made so far
+      raise errors[0]
+
+    stats = BackfillStats(numMetrics=self._numMetrics,
+                          numRows=self._numRows,
+                          numMessages=self._numMessages)
+    g_log.info("Backfill done: %r", stats)
+    return stats
+
+
+  def _publish(self, messageBus, body, properties):
+    self._throttle.wait()
+    messageBus.publishExg(exchange=self._resultsExchange,
+                          routingKey="",
+                          body=body,
+                          properties=properties)
+    with self._statsLock:
+      self._numMessages += 1
+
+
+  def _backfillMetric(self, messageBus, uid):
+    checkpoint = (self._checkpoint.get(uid) or
+                  MetricCheckpoint(lastRowid=-1, numRows=0, done=False))
+
+    page = self._getMetricDataPage(uid, afterRowid=checkpoint.lastRowid)
+    if not page:
+      self._checkpoint.update(uid, checkpoint._replace(done=True))
+      return
+
+    metricObj = self._getMetric(uid)
+    modelSpec = json.loads(metricObj.parameters)
+
+    # Send defineModel command to ensure that the metric table entry is created
+    modelCommandResult = {
+      "status": htmengineerrno.SUCCESS,
+      "method": "defineModel",
+      "modelId": uid,
+      "modelInfo": {
+        "metricName": metricObj.name,
+        "resource": metricObj.server,
+        "modelSpec": modelSpec
+      }
+    }
+
+    g_log.info("Sending `defineModel` command: %r", modelCommandResult)
+    self._publish(messageBus,
+                  AnomalyService._serializeModelResult(modelCommandResult),
+                  self._modelCommandResultProperties)
+
+    metricInfo = dict(
+      uid=metricObj.uid,
+      name=metricObj.name,
+      description=metricObj.description,
+      resource=metricObj.server,
+      location=metricObj.location,
+      datasource=metricObj.datasource,
+      spec=modelSpec["metricSpec"]
+    )
+
+    while page:
+      for i in xrange(0, len(page), self._batchSize):
+        batch = page[i:i + self._batchSize]
+
+        inferenceResultsMessage = dict(
+          metric=metricInfo,
+          results=[
+            dict(
+              rowid=row.rowid,
+              ts=epochFromNaiveUTCDatetime(row.timestamp),
+              value=row.metric_value,
+              rawAnomaly=row.raw_anomaly_score,
+              anomaly=row.anomaly_score
+            )
+            for row in batch
+          ]
+        )
+
+        self._publish(
+          messageBus,
+          AnomalyService._serializeModelResult(inferenceResultsMessage),
+          self._modelInferenceResultProperties)
+
+        checkpoint = checkpoint._replace(lastRowid=batch[-1].rowid,
+                                         numRows=checkpoint.numRows + len(batch))
+        self._checkpoint.update(uid, checkpoint)
+
+        with self._statsLock:
+          self._numRows += len(batch)
+
+      g_log.debug("uid=%s rows=%d from %s to %s", uid, len(page),
+                  page[0].timestamp, page[-1].timestamp)
+
+      if len(page) < self._pageSize:
+        break
+
+      page = self._getMetricDataPage(uid, afterRowid=checkpoint.lastRowid)
+
+    self._checkpoint.update(uid, checkpoint._replace(done=True))
+
+    with self._statsLock:
+      self._numMetrics += 1
+
+    g_log.info("Backfilled uid=%s; rows=%d", uid, checkpoint.numRows)
+
+
+  def verify(self, countDestinationRows, metricIds=None, fromTimestamp=None):
+    """ Compare the per-metric row counts of the repository and the destination
+
+    :param countDestinationRows: function(uid, fromTimestamp) that returns the
+      number of the metric's rows at the destination at or after
+      fromTimestamp; e.g., DynamoDBMetricDataCounter
+    :param metricIds: uids of the metrics to verify; None for the metrics in
+      the checkpoint
+    :param datetime fromTimestamp: naive UTC timestamp of the earliest rows to
+      compare; defaults to the start of the backfill window. Pass a later
+      timestamp to exclude rows that the destination expired.
+    :returns: CountMismatch of each metric whose counts differ
+    :rtype: list
+    """
+    if metricIds is None:
+      metricIds = sorted(self._checkpoint.getAll())
+
+    if fromTimestamp is None:
+      fromTimestamp = self.fromTimestamp
+
+    mismatches = []
+    for uid in metricIds:
+      sourceCount = self._getSourceCount(uid, fromTimestamp)
+      destinationCount = countDestinationRows(uid, fromTimestamp)
+      if sourceCount != destinationCount:
+        g_log.warning("Row count mismatch: uid=%s; source=%d; destination=%d",
+                      uid, sourceCount, destinationCount)
+        mismatches.append(CountMismatch(uid=uid,
+                                        sourceCount=sourceCount,
+                                        destinationCount=destinationCount))
+
+    g_log.info("Verified %d metrics; %d mismatches", len(metricIds),
+               len(mismatches))
+    return mismatches
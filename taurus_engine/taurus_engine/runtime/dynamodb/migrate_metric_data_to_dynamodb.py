@@ -21,29 +21,24 @@
 # ----------------------------------------------------------------------
 
 import argparse
-import datetime
-from itertools import groupby, izip_longest
-import json
-import select
-import socket
 import sys
 
-from taurus_engine import config, repository, logging_support, taurus_logging
-from taurus_engine.repository.schema import metric_data
+from taurus_engine import repository, logging_support, taurus_logging
+from taurus_engine.runtime.dynamodb.dynamodb_service import DynamoDBService
+from taurus_engine.runtime.dynamodb.metric_data_backfill import (
+  DEFAULT_BATCH_SIZE,
+  DEFAULT_MAX_MESSAGES_PER_SEC,
+  DEFAULT_NUM_WORKERS,
+  DEFAULT_PAGE_SIZE,
+  DynamoDBMetricDataCounter,
+  MetricDataBackfill)
 
-from nta.utils import amqp
-from nta.utils.date_time_utils import epochFromNaiveUTCDatetime
 from nta.utils.message_bus_connector import MessageBusConnector
-from nta.utils.message_bus_connector import MessageProperties
-from nta.utils.sqlalchemy_utils import retryOnTransientErrors
 
-from htmengine import htmengineerrno
 
-from htmengine.runtime import anomaly_service
 
-
-
-DEFAULT_CHUNKSIZE = 25 # Max number of rows to include in a single batch
+DEFAULT_CHUNKSIZE = DEFAULT_BATCH_SIZE # Max number of rows to include in a
+                                       # single batch
 
 
 
@@ -51,123 +46,60 @@ g_log = taurus_logging.getExtendedLogger(__name__)
 
 
 
-def replayMetricDataToModelResultsExchange(messageBus,
-                                           chunksize=DEFAULT_CHUNKSIZE):
+def replayMetricDataToModelResultsExchange(checkpointPath,
+                                           messageBusFactory=MessageBusConnector,
+                                           chunksize=DEFAULT_CHUNKSIZE,
+                                           numWorkers=DEFAULT_NUM_WORKERS,
+                                           pageSize=DEFAULT_PAGE_SIZE,
+                                           maxMessagesPerSec=(
+                                             DEFAULT_MAX_MESSAGES_PER_SEC)):
   """ Reads metric data and synthesizes model inference result messages to the
   "model results" exchange, simulating the end result of the AnomalyService.
-  This will afford the dynamodb service an opportunity to backfill older data
-  :param messageBus: message bus connection
-  :type messageBus: nta.utils.message_bus_connector.MessageBusConnector
+  This will afford the dynamodb service an opportunity to backfill older data.
+
+  Resumes the backfill recorded in the checkpoint file, if any.
+
+  :param str checkpointPath: path of the backfill's checkpoint file
+  :param messageBusFactory: function that returns a new message bus connection;
+    one per worker
+  :param int chunksize: max number of rows per model inference results message
+  :param int numWorkers: number of worker threads
+  :param int pageSize: max number of rows per repository query
+  :param maxMessagesPerSec: max number of messages published per second; 0 for
+    no limit
+  :returns: metric_data_backfill.BackfillStats
   """
-  engine = repository.engineFactory()
-
-  twoWeeksAgo = datetime.datetime.utcnow() - datetime.timedelta(days=14)
-
-  # Properties for publishing model command results on RabbitMQ exchange
-  # (same as AnomalyService)
-  modelCommandResultProperties = MessageProperties(
-      deliveryMode=amqp.constants.AMQPDeliveryModes.PERSISTENT_MESSAGE,
-      headers=dict(dataType="model-cmd-result"))
-
-  # Properties for publishing model inference results on RabbitMQ exchange
-  # (same as AnomalyService)
-  modelInferenceResultProperties = MessageProperties(
-    deliveryMode=amqp.constants.AMQPDeliveryModes.PERSISTENT_MESSAGE)
-
-  g_log.info("Getting metric data...")
-  result = repository.getMetricData(engine,
-                                    score=0,
-                                    fromTimestamp=twoWeeksAgo,
-                                    sort=[metric_data.c.uid,
-                                          metric_data.c.rowid.asc()])
-  numMetricDataRows = result.rowcount
-  g_log.info("Got %d rows", numMetricDataRows)
-
-  numModels = 0
-  for uid, group in groupby(result, key=lambda x: x.uid):
-
-    @retryOnTransientErrors
-    def _getMetric():
-      return repository.getMetric(engine, uid)
-
-    metricObj = _getMetric()
-
-    # Send defineModel command to ensure that the metric table entry is created
-    numModels += 1
-    modelCommandResult = {
-      "status": htmengineerrno.SUCCESS,
-      "method": "defineModel",
-      "modelId": uid,
-      "modelInfo": {
-        "metricName": metricObj.name,
-        "resource": metricObj.server,
-        "modelSpec": json.loads(metricObj.parameters)
-      }
-    }
-
-    # Serialize
-    payload = anomaly_service.AnomalyService._serializeModelResult(
-      modelCommandResult)
-
-    g_log.info("Sending `defineModel` command: %r", repr(modelCommandResult))
-    messageBus.publishExg(
-      exchange=config.get("metric_streamer", "results_exchange_name"),
-      routingKey="",
-      body=payload,
-      properties=modelCommandResultProperties)
-
-    metricInfo = dict(
-      uid=metricObj.uid,
-      name=metricObj.name,
-      description=metricObj.description,
-      resource=metricObj.server,
-      location=metricObj.location,
-      datasource=metricObj.datasource,
-      spec=json.loads(metricObj.parameters)["metricSpec"]
-    )
-
-    args = [iter(group)] * chunksize
-    for num, chunk in enumerate(izip_longest(fillvalue=None, *args)):
-      # Create
-      inferenceResultsMessage = dict(
-        metric=metricInfo,
-
-        results=[
-          dict(
-            rowid=row.rowid,
-            ts=epochFromNaiveUTCDatetime(row.timestamp),
-            value=row.metric_value,
-            rawAnomaly=row.raw_anomaly_score,
-            anomaly=row.anomaly_score
-          )
-          for row in chunk if row is not None
-        ]
-      )
-
-      # Serialize
-      payload = anomaly_service.AnomalyService._serializeModelResult(
-        inferenceResultsMessage)
-
-      g_log.info(
-        "uid=%s chunk=%d rows=%d payload_size=%d bytes from %s to %s",
-        uid,
-        num,
-        len(inferenceResultsMessage["results"]),
-        sys.getsizeof(payload),
-        datetime.datetime.utcfromtimestamp(
-          inferenceResultsMessage["results"][0].ts),
-        datetime.datetime.utcfromtimestamp(
-          inferenceResultsMessage["results"][-1].timestamp))
-
-      messageBus.publishExg(
-        exchange=config.get("metric_streamer", "results_exchange_name"),
-        routingKey="",
-        body=payload,
-        properties=modelInferenceResultProperties)
-
-
-  g_log.info("Done! numMetricDataRows=%d; numModels=%d",
-             numMetricDataRows, numModels)
+  backfill = MetricDataBackfill(engine=repository.engineFactory(),
+                                messageBusFactory=messageBusFactory,
+                                checkpointPath=checkpointPath,
+                                numWorkers=numWorkers,
+                                batchSize=chunksize,
+                                pageSize=pageSize,
+                                maxMessagesPerSec=maxMessagesPerSec)
+  try:
+    return backfill.run()
+  finally:
+    backfill.close()
+
+
+
+def verifyMetricDataInDynamoDB(checkpointPath):
+  """ Compare the per-metric row counts of the repository and DynamoDB for the
+  metrics of the backfill recorded in the checkpoint file
+
+  :param str checkpointPath: path of the backfill's checkpoint file
+  :returns: metric_data_backfill.CountMismatch of each metric whose counts
+    differ
+  :rtype: list
+  """
+  backfill = MetricDataBackfill(engine=repository.engineFactory(),
+                                messageBusFactory=MessageBusConnector,
+                                checkpointPath=checkpointPath)
+  try:
+    return backfill.verify(
+      DynamoDBMetricDataCounter(DynamoDBService.connectDynamoDB()))
+  finally:
+    backfill.close()
 
 
 
@@ -176,6 +108,12 @@ if __name__ == "__main__":
 
   parser = argparse.ArgumentParser(
     description="Replay metric data to model results exchange")
+  parser.add_argument("--checkpoint",
+                      required=True,
+                      metavar="PATH",
+                      help=("Path of the file recording the progress of the "
+                            "backfill; an interrupted backfill resumes from "
+                            "it. Delete it to start a new backfill."))
   parser.add_argument("--chunksize",
                       type=int,
                       default=DEFAULT_CHUNKSIZE,
@@ -183,9 +121,39 @@ if __name__ == "__main__":
                       help=("Maximum number of records to include in a batch of"
                             "model inference results message to model results "
                             "exchange"))
+  parser.add_argument("--workers",
+                      type=int,
+                      default=DEFAULT_NUM_WORKERS,
+                      metavar="NUM",
+                      help="Number of metrics backfilled concurrently")
+  parser.add_argument("--pagesize",
+                      type=int,
+                      default=DEFAULT_PAGE_SIZE,
+                      metavar="NUM",
+                      help="Maximum number of records per database query")
+  parser.add_argument("--max-messages-per-sec",
+                      type=float,
+                      default=DEFAULT_MAX_MESSAGES_PER_SEC,
+                      metavar="NUM",
+                      help=("Maximum number of messages published per second; "
+                            "0 for no limit"))
+  parser.add_argument("--verify",
+                      action="store_true",
+                      help=("Instead of backfilling, compare per-metric record "
+                            "counts of the backfill in the checkpoint file "
+                            "with those in DynamoDB"))
 
   _args = parser.parse_args()
 
-  with MessageBusConnector() as messageBus:
-    replayMetricDataToModelResultsExchange(messageBus=messageBus,
-                                           chunksize=_args.chunksize)
+  if _args.verify:
+    _mismatches = verifyMetricDataInDynamoDB(checkpointPath=_args.checkpoint)
+    for _mismatch in _mismatches:
+      print "%s: source=%d dynamodb=%d" % _mismatch
+    sys.exit(1 if _mismatches else 0)
+
+  replayMetricDataToModelResultsExchange(
+    checkpointPath=_args.checkpoint,
+    chunksize=_args.chunksize,
+    numWorkers=_args.workers,
+    pageSize=_args.pagesize,
+    maxMessagesPerSec=_args.max_messages_per_sec)
@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Benchmark DynamoDBService message handling: sequential `messageHandler()`
+versus `DynamoDBWritePipeline`, against an in-process fake of DynamoDB that
+adds a fixed latency to every request.
+
+The workload simulates catch-up: a backlog of model inference result messages
+spread over many metrics. Both runs must leave the fake tables in the same
+state.
+"""
+
+from datetime import datetime, timedelta
+from optparse import OptionParser
+import random
+import threading
+import time
+
+from boto.dynamodb2.exceptions import (ConditionalCheckFailedException,
+                                       ValidationException)
+from mock import Mock
+
+from nta.utils import amqp
+from nta.utils.date_time_utils import epochFromNaiveUTCDatetime
+
+from htmengine.runtime.anomaly_service import AnomalyService
+
+from taurus_engine import logging_support
+from taurus_engine.runtime.dynamodb.dynamodb_service import DynamoDBService
+from taurus_engine.runtime.dynamodb.dynamodb_write_pipeline import (
+  DynamoDBWritePipeline)
+
+
+
+class _FakeDynamoDB(object):
+  """ In-process stand-in for the parts of the DynamoDB API used by
+  DynamoDBService; every request sleeps for `latency` seconds
+  """
+
+  def __init__(self, latency):
+    self.latency = latency
+    self.lock = threading.Lock()
+    self.tables = {}
+    self.numRequests = 0
+
+
+  def request(self):
+    time.sleep(self.latency)
+    with self.lock:
+      self.numRequests += 1
+
+
+  def update_item(self, table_name, key, update_expression,
+                  condition_expression, expression_attribute_values):
+    self.request()
+    metricType = update_expression.split()[1].split(".", 1)[1]
+    value = float(expression_attribute_values[":value"]["N"])
+    itemKey = (key["instance_id"]["S"], key["date_hour"]["S"])
+
+    with self.lock:
+      item = self.tables.setdefault(table_name, {}).get(itemKey)
+      if item is None:
+        raise ValidationException(400, "The document path provided in the "
+                                  "update expression is invalid for update")
+      scores = item["anomaly_score"]["M"]
+      if metricType in scores and float(scores[metricType]["N"]) >= value:
+        raise ConditionalCheckFailedException(400, "condition failed")
+      scores[metricType] = {"N": str(value)}
+
+
+  def put_item(self, table_name, item, condition_expression):
+    self.request()
+    itemKey = (item["instance_id"]["S"], item["date_hour"]["S"])
+
+    with self.lock:
+      table = self.tables.setdefault(table_name, {})
+      if itemKey in table:
+        raise ConditionalCheckFailedException(400, "condition failed")
+      table[itemKey] = item
+
+
+
+class _FakeBatchWrite(object):
+  BATCH_SIZE = 25
+
+  def __init__(self, table):
+    self._table = table
+    self._items = []
+
+
+  def __enter__(self):
+    return self
+
+
+  def __exit__(self, *args):
+    if self._items:
+      self._flush()
+    return False
+
+
+  def put_item(self, data, overwrite=False):
+    self._items.append(data)
+    if len(self._items) == self.BATCH_SIZE:
+      self._flush()
+
+
+  def _flush(self):
+    db = self._table.db
+    db.request()
+    with db.lock:
+      table = db.tables.setdefault(self._table.table_name, {})
+      for item in self._items:
+        table[(item["uid"], item["timestamp"])] = dict(item)
+    self._items = []
+
+
+
+class _FakeTable(object):
+  def __init__(self, db, tableName):
+    self.db = db
+    self.table_name = tableName
+
+
+  def batch_write(self):
+    return _FakeBatchWrite(self)
+
+
+  def put_item(self, data, overwrite=False):
+    self.db.request()
+
+
+
+class _BenchmarkDynamoDBService(DynamoDBService):
+  """ DynamoDBService backed by _FakeDynamoDB """
+
+  def __init__(self, db):
+    self._db = db
+    super(_BenchmarkDynamoDBService, self).__init__()
+
+
+  def connectDynamoDB(self):
+    return self._db
+
+
+  def _gracefulCreateTable(self, definition):
+    return _FakeTable(self._db, definition.tableName)
+
+
+
+def _generateMessages(numMessages, numMetrics, rowsPerMessage):
+  """ Generate serialized model inference result messages, in per-metric
+  timestamp order
+  """
+  rng = random.Random(42)
+  start = datetime.utcnow().replace(second=0, microsecond=0) - timedelta(days=1)
+  nextTimestamp = dict((i, epochFromNaiveUTCDatetime(start))
+                       for i in xrange(numMetrics))
+
+  messages = []
+  for i in xrange(numMessages):
+    metricIndex = rng.randrange(numMetrics)
+    rows = []
+    for _ in xrange(rowsPerMessage):
+      ts = nextTimestamp[metricIndex]
+      nextTimestamp[metricIndex] += 300
+      rows.append(dict(rowid=i, ts=ts, value=rng.uniform(0, 1000),
+                       rawAnomaly=rng.random(), anomaly=rng.random()))
+
+    batch = dict(
+      metric=dict(
+        uid="metric%04d" % (metricIndex,),
+        name="XIGNITE.SYM%d.VOLUME" % (metricIndex,),
+        resource="SYM%d" % (metricIndex % (numMetrics // 4 or 1),),
+        spec=dict(userInfo=dict(symbol="SYM%d" % (metricIndex,),
+                                metricType="StockVolume%d" % (metricIndex % 4),
+                                metricTypeName="Stock Volume"))),
+      results=rows)
+
+    messages.append(AnomalyService._serializeModelResult(batch))
+
+  return messages
+
+
+
+def _makeMessage(body, acks):
+  return amqp.messages.ConsumerMessage(
+    body=body,
+    properties=Mock(headers=dict()),
+    methodInfo=amqp.messages.MessageDeliveryInfo(consumerTag="tag",
+                                                 deliveryTag=len(acks),
+                                                 redelivered=False,
+                                                 exchange="",
+                                                 routingKey=""),
+    ackImpl=lambda deliveryTag, multiple: acks.append(deliveryTag),
+    nackImpl=None)
+
+
+
+def _runSequential(bodies, latency):
+  db = _FakeDynamoDB(latency)
+  service = _BenchmarkDynamoDBService(db)
+  acks = []
+
+  start = time.time()
+  for body in bodies:
+    service.messageHandler(_makeMessage(body, acks))
+  duration = time.time() - start
+
+  assert len(acks) == len(bodies)
+  return duration, db
+
+
+
+def _runPipeline(bodies, latency, numWorkers, prefetchCount):
+  db = _FakeDynamoDB(latency)
+  service = _BenchmarkDynamoDBService(db)
+  pipeline = DynamoDBWritePipeline(
+    numWorkers=numWorkers,
+    writeMetricDataItems=service._writeMetricDataItems,
+    writeInstanceDataHourlyScore=service._putInstanceDataHourlyScore)
+  acks = []
+
+  start = time.time()
+  pipeline.start()
+  try:
+    for body in bodies:
+      message = _makeMessage(body, acks)
+      pipeline.submit(message, service._prepareMessageWrites(message))
+      pipeline.ackCompleted()
+      # The broker stops delivering once prefetch_count messages are unacked
+      if pipeline.numPending >= prefetchCount:
+        pipeline.drain()
+    pipeline.drain()
+  finally:
+    pipeline.stop()
+  duration = time.time() - start
+
+  assert len(acks) == len(bodies)
+  return duration, db
+
+
+
+def _parseArgs():
+  parser = OptionParser(usage="%prog [options]\n\n" + __doc__.strip())
+  parser.add_option("--messages", dest="numMessages", type="int",
+                    default=2000,
+                    help="number of messages [default: %default]")
+  parser.add_option("--metrics", dest="numMetrics", type="int", default=200,
+                    help="number of metrics [default: %default]")
+  parser.add_option("--rows", dest="rowsPerMessage", type="int", default=3,
+                    help="model inference result rows per message "
+                         "[default: %default]")
+  parser.add_option("--latency", dest="latencyMs", type="float", default=5.0,
+                    help="latency of each fake DynamoDB request in "
+                         "milliseconds [default: %default]")
+  parser.add_option("--workers", dest="numWorkers", type="int", default=4,
+                    help="number of pipeline writer threads "
+                         "[default: %default]")
+  parser.add_option("--prefetch", dest="prefetchCount", type="int",
+                    default=50,
+                    help="maximum number of unacked messages "
+                         "[default: %default]")
+
+  options, _ = parser.parse_args()
+  return vars(options)
+
+
+
+def main(numMessages, numMetrics, rowsPerMessage, latencyMs, numWorkers,
+         prefetchCount):
+  logging_support.LoggingSupport.initTool()
+
+  bodies = _generateMessages(numMessages, numMetrics, rowsPerMessage)
+  latency = latencyMs / 1000.0
+
+  print ("%d messages of %d rows over %d metrics; %.1fms per DynamoDB request"
+         % (numMessages, rowsPerMessage, numMetrics, latencyMs))
+
+  sequentialDuration, sequentialDB = _runSequential(bodies, latency)
+  print "sequential: %.2fs (%.0f msg/s, %d requests)" % (
+    sequentialDuration, numMessages / sequentialDuration,
+    sequentialDB.numRequests)
+
+  pipelineDuration, pipelineDB = _runPipeline(bodies, latency, numWorkers,
+                                              prefetchCount)
+  print "pipeline (%d workers, prefetch %d): %.2fs (%.0f msg/s, %d requests)" % (
+    numWorkers, prefetchCount, pipelineDuration,
+    numMessages / pipelineDuration, pipelineDB.numRequests)
+
+  print "speedup: %.1fx" % (sequentialDuration / pipelineDuration,)
+
+  assert pipelineDB.tables == sequentialDB.tables, (
+    "Pipeline and sequential runs wrote different data")
+
+
+
+if __name__ == "__main__":
+  main(**_parseArgs())
@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Benchmark the model consistency checks on a synthetic fleet of models: the
+repository vs. DynamoDB checks of check_model_consistency, which load all metric
+rows and scan the whole DynamoDB metric table sequentially, versus the
+streaming cross-check of model_id_consistency over the repository, model
+checkpoint directories, model input queues and a parallel segmented DynamoDB
+scan.
+
+The repository is a SQLite database, checkpoints are empty directories named
+after the models and DynamoDB is an in-process fake that sleeps for a fixed
+latency per scan page. A small fraction of the models is made inconsistent.
+"""
+
+import json
+from optparse import OptionParser
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+
+import sqlalchemy as sql
+from sqlalchemy.dialects.mysql import DOUBLE
+from sqlalchemy.ext.compiler import compiles
+
+from htmengine.repository.queries import MetricStatus
+
+from taurus_engine import check_model_consistency
+from taurus_engine import logging_support
+from taurus_engine import model_id_consistency
+from taurus_engine import repository
+from taurus_engine.repository import schema
+
+
+
+@compiles(DOUBLE, "sqlite")
+def _compileDoubleForSQLite(_type, _compiler, **_kw):
+  return "REAL"
+
+
+
+class _FakeMetricTable(object):
+  """ In-process stand-in for boto.dynamodb2.table.Table of the metric table;
+  returns scan results in pages of `pageSize` items, sleeping for `latency`
+  seconds per page
+  """
+
+  def __init__(self, items, pageSize, latency):
+    self._items = items
+    self._pageSize = pageSize
+    self._latency = latency
+
+
+  def scan(self, segment=None, total_segments=None, attributes=None):
+    if total_segments:
+      items = self._items[segment::total_segments]
+    else:
+      items = self._items
+
+    for i, item in enumerate(items):
+      if i % self._pageSize == 0:
+        time.sleep(self._latency)
+
+      if attributes:
+        yield dict((name, item[name]) for name in attributes)
+      else:
+        yield dict(item)
+
+
+
+class _DirectoryCheckpointMgr(object):
+  """ Lists model IDs like ModelCheckpointMgr.getModelIDs() """
+
+  def __init__(self, storageRoot):
+    self._storageRoot = storageRoot
+
+
+  def getModelIDs(self):
+    return [name for name in os.listdir(self._storageRoot)
+            if not name.startswith(".")]
+
+
+
+class _FakeSwapperInterface(object):
+
+  def __init__(self, modelIds):
+    self._modelIds = modelIds
+
+
+  def getModelIDsWithInputQueues(self):
+    return tuple(self._modelIds)
+
+
+
+def _parseArgs():
+  parser = OptionParser(usage="%prog [options]\n\n" + __doc__.strip())
+
+  parser.add_option("--models", type="int", default=20000, dest="numModels",
+                    help="Number of models [default: %default]")
+  parser.add_option("--inconsistent-fraction", type="float", default=0.01,
+                    dest="inconsistentFraction",
+                    help=("Fraction of models made inconsistent "
+                          "[default: %default]"))
+  parser.add_option("--scan-page-size", type="int", default=1000,
+                    dest="scanPageSize",
+                    help="Items per DynamoDB scan page [default: %default]")
+  parser.add_option("--scan-latency", type="float", default=0.05,
+                    dest="scanLatency",
+                    help=("Simulated seconds per DynamoDB scan page "
+                          "[default: %default]"))
+  parser.add_option("--scan-segments", type="int", default=8,
+                    dest="scanSegments",
+                    help="Segments of the parallel scan [default: %default]")
+
+  options, remainingArgs = parser.parse_args()
+  if remainingArgs:
+    parser.error("Unexpected remaining args: %r" % (remainingArgs,))
+
+  return options.__dict__
+
+
+
+def _createFixture(tempDir, numModels, inconsistentFraction):
+  """ Create the repository, checkpoint directories, input queue names and
+  DynamoDB items of the models
+
+  :returns: (engine, checkpointRoot, inputQueueIds, dynamodbItems)
+  """
+  rnd = random.Random(42)
+
+  engine = sql.create_engine(
+    "sqlite:///%s" % (os.path.join(tempDir, "repository.db"),))
+  schema.metric.create(engine)
+
+  checkpointRoot = os.path.join(tempDir, "checkpoints")
+  os.mkdir(checkpointRoot)
+
+  metrics = []
+  inputQueueIds = []
+  dynamodbItems = []
+
+  for i in xrange(numModels):
+    uid = uuid.UUID(int=rnd.getrandbits(128)).hex
+    symbol = "SYM%d" % (i,)
+    metric = dict(
+      uid=uid,
+      datasource="custom",
+      name="XIGNITE.%s.VOLUME" % (symbol,),
+      description="",
+      server="Company %d" % (i,),
+      location="",
+      status=MetricStatus.ACTIVE,
+      parameters=json.dumps({
+        "datasource": "custom",
+        "metricSpec": {"metric": "XIGNITE.%s.VOLUME" % (symbol,),
+                       "resource": "Company %d" % (i,),
+                       "userInfo": {"metricType": "StockVolume",
+                                    "metricTypeName": "Stock Volume",
+                                    "symbol": symbol}}}))
+    item = dict(uid=uid,
+                name=metric["name"],
+                display_name=metric["server"],
+                metricType="StockVolume",
+                metricTypeName="Stock Volume",
+                symbol=symbol)
+
+    inRepository = inCheckpoints = inInputQueues = inDynamoDB = True
+    if rnd.random() < inconsistentFraction:
+      choice = rnd.randrange(4)
+      if choice == 0:
+        inRepository = False
+      elif choice == 1:
+        inCheckpoints = False
+      elif choice == 2:
+        inInputQueues = False
+      else:
+        inDynamoDB = False
+
+    if inRepository:
+      metrics.append(metric)
+    if inCheckpoints:
+      os.mkdir(os.path.join(checkpointRoot, uid))
+    if inInputQueues:
+      inputQueueIds.append(uid)
+    if inDynamoDB:
+      dynamodbItems.append(item)
+
+  engine.execute(schema.metric.insert(), metrics)
+
+  return engine, checkpointRoot, inputQueueIds, dynamodbItems
+
+
+
+def main(numModels, inconsistentFraction, scanPageSize, scanLatency,
+         scanSegments):
+  logging_support.LoggingSupport.initTool()
+
+  tempDir = tempfile.mkdtemp()
+  try:
+    engine, checkpointRoot, inputQueueIds, dynamodbItems = _createFixture(
+      tempDir, numModels, inconsistentFraction)
+
+    table = _FakeMetricTable(dynamodbItems, pageSize=scanPageSize,
+                             latency=scanLatency)
+
+    # Repository vs. DynamoDB checks of check_model_consistency
+    start = time.time()
+    with engine.connect() as conn:
+      engineMetrics = repository.getAllMetrics(conn).fetchall()
+    dynamodbMetrics = tuple(table.scan())
+    warnings, errors = check_model_consistency._runAllChecks(
+      engineMetrics=engineMetrics,
+      dynamodbMetrics=dynamodbMetrics,
+      verbose=False)
+    fullLoadDuration = time.time() - start
+    print ("Full load (repository, dynamodb): %.2fs; %d warnings, %d errors"
+           % (fullLoadDuration, len(warnings), len(errors)))
+
+    # Streaming cross-check of all sources
+    checkpointMgr = _DirectoryCheckpointMgr(checkpointRoot)
+    swapperInterface = _FakeSwapperInterface(inputQueueIds)
+    sources = (
+      model_id_consistency.ModelIdSource(
+        model_id_consistency.REPOSITORY,
+        lambda: model_id_consistency.iterRepositoryEntries(engine)),
+      model_id_consistency.ModelIdSource(
+        model_id_consistency.CHECKPOINTS,
+        lambda: model_id_consistency.iterCheckpointEntries(checkpointMgr)),
+      model_id_consistency.ModelIdSource(
+        model_id_consistency.INPUT_QUEUES,
+        lambda: model_id_consistency.iterInputQueueEntries(swapperInterface)),
+      model_id_consistency.ModelIdSource(
+        model_id_consistency.DYNAMODB,
+        lambda: model_id_consistency.iterDynamoDBEntries(
+          tableFactory=lambda: table, totalSegments=scanSegments))
+    )
+
+    start = time.time()
+    report = model_id_consistency.crossCheck(sources, includeRepairPlan=True)
+    crossCheckDuration = time.time() - start
+    print ("Streaming cross-check (%s, %d scan segments): %.2fs; "
+           "%d warnings, %d errors, %d repair actions"
+           % (", ".join(report["sources"]), scanSegments, crossCheckDuration,
+              report["numWarnings"], report["numErrors"],
+              len(report["repairPlan"])))
+    print "Models per source: %s" % (
+      ", ".join("%s=%d" % (name, report["modelCounts"][name])
+                for name in report["sources"]),)
+    print "Findings: %s" % (json.dumps(report["findingCounts"],
+                                       sort_keys=True),)
+  finally:
+    shutil.rmtree(tempDir)
+
+
+
+if __name__ == "__main__":
+  main(**_parseArgs())
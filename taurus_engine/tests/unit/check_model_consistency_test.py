@@ -193,6 +193,41 @@ class CheckModelConsitencyTestCase(unittest.TestCase):
       check_model_consistency.main(args=[])
 
 
+  @patch("taurus_engine.check_model_consistency.checkAndReport", autospec=True)
+  @patch("taurus_engine.check_model_consistency.crossCheckAndReport",
+         autospec=True)
+  def testMainWithSourcesCrossChecks(self, crossCheckAndReportMock,
+                                     checkAndReportMock):
+
+    crossCheckAndReportMock.return_value = 1
+
+    self.assertEqual(
+      check_model_consistency.main(
+        args=["--sources", "dynamodb,repository", "--report", "-",
+              "--repairPlan", "--scanSegments", "8"]),
+      1)
+
+    self.assertEqual(checkAndReportMock.call_count, 0)
+    crossCheckAndReportMock.assert_called_once_with(
+      sourceNames=("repository", "dynamodb"),
+      verbose=False,
+      warningsAsErrors=False,
+      reportPath="-",
+      repairPlan=True,
+      scanSegments=8)
+
+
+  def testParseArgsRejectsInvalidCrossCheckArgs(self):
+    for args in (["--sources", "repository,nosuchsource"],
+                 ["--sources", ""],
+                 ["--report", "report.json"],
+                 ["--sources", "dynamodb", "--scanSegments", "0"]):
+      with self.assertRaises(SystemExit) as excCtx:
+        check_model_consistency._parseArgs(args)
+
+      self.assertEqual(excCtx.exception.code, 2)
+
+
   @patch("taurus_engine.check_model_consistency._parseArgs",
          autospec=True)
   @patch("taurus_engine.check_model_consistency.checkAndReport",
@@ -0,0 +1,331 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Unit tests for taurus_engine.model_id_consistency against a SQLite repository
+and local stand-ins for model checkpoints, input queues and DynamoDB
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import sqlalchemy as sql
+from sqlalchemy.dialects.mysql import DOUBLE
+from sqlalchemy.ext.compiler import compiles
+
+from htmengine.repository.queries import MetricStatus
+
+from taurus_engine import logging_support
+from taurus_engine import model_id_consistency
+from taurus_engine.model_id_consistency import ModelIdSource, RepairAction
+from taurus_engine.repository import schema
+
+
+
+@compiles(DOUBLE, "sqlite")
+def _compileDoubleForSQLite(_type, _compiler, **_kw):
+  return "REAL"
+
+
+
+def setUpModule():
+  logging_support.LoggingSupport.initTestApp()
+
+
+
+def _createMetric(uid, status):
+  return dict(
+    uid=uid,
+    datasource="custom",
+    name="METRIC.%s" % (uid,),
+    description="",
+    server="Company %s" % (uid,),
+    location="",
+    status=status,
+    parameters=json.dumps({
+      "datasource": "custom",
+      "metricSpec": {"metric": "METRIC.%s" % (uid,),
+                     "resource": "Company %s" % (uid,),
+                     "userInfo": {"metricType": "StockVolume",
+                                  "metricTypeName": "Stock Volume",
+                                  "symbol": "SYM.%s" % (uid,)}}}))
+
+
+
+def _createDynamoDBItem(metric):
+  return dict(
+    uid=metric["uid"],
+    name=metric["name"],
+    display_name=metric["server"],
+    metricType="StockVolume",
+    metricTypeName="Stock Volume",
+    symbol="SYM.%s" % (metric["uid"],),
+    # Not requested by the scan
+    extra="x")
+
+
+
+class _FakeCheckpointMgr(object):
+
+  def __init__(self, modelIds):
+    self.modelIds = list(modelIds)
+
+
+  def getModelIDs(self):
+    return list(self.modelIds)
+
+
+
+class _FakeSwapperInterface(object):
+
+  def __init__(self, modelIds):
+    self.modelIds = list(modelIds)
+
+
+  def getModelIDsWithInputQueues(self):
+    return tuple(self.modelIds)
+
+
+
+class _FakeMetricTable(object):
+  """ Stand-in for boto.dynamodb2.table.Table of the metric table; supports
+  segmented scans
+  """
+
+  def __init__(self, items, scans):
+    self._items = items
+    self._scans = scans
+
+
+  def scan(self, segment, total_segments, attributes):
+    self._scans.append((segment, total_segments))
+    for item in self._items:
+      if hash(item["uid"]) % total_segments == segment:
+        yield dict((name, item[name]) for name in attributes)
+
+
+
+class ModelIdConsistencyTestCase(unittest.TestCase):
+
+  def setUp(self):
+    tempDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tempDir)
+
+    self.engine = sql.create_engine(
+      "sqlite:///%s" % (os.path.join(tempDir, "repository.db"),))
+    self.addCleanup(self.engine.dispose)
+    schema.metric.create(self.engine)
+
+    self.metrics = [_createMetric("uid%03d" % (i,), MetricStatus.ACTIVE)
+                    for i in xrange(25)]
+    self.dynamodbItems = [_createDynamoDBItem(metric)
+                          for metric in self.metrics]
+    self.checkpointIds = [metric["uid"] for metric in self.metrics]
+    self.inputQueueIds = [metric["uid"] for metric in self.metrics]
+    self.scans = []
+
+
+  def _createSources(self, pageSize=10, totalSegments=3):
+    if self.metrics:
+      self.engine.execute(schema.metric.insert(), self.metrics)
+
+    checkpointMgr = _FakeCheckpointMgr(reversed(self.checkpointIds))
+    swapperInterface = _FakeSwapperInterface(reversed(self.inputQueueIds))
+
+    return (
+      ModelIdSource(
+        model_id_consistency.REPOSITORY,
+        lambda: model_id_consistency.iterRepositoryEntries(self.engine,
+                                                           pageSize=pageSize)),
+      ModelIdSource(
+        model_id_consistency.CHECKPOINTS,
+        lambda: model_id_consistency.iterCheckpointEntries(checkpointMgr)),
+      ModelIdSource(
+        model_id_consistency.INPUT_QUEUES,
+        lambda: model_id_consistency.iterInputQueueEntries(swapperInterface)),
+      ModelIdSource(
+        model_id_consistency.DYNAMODB,
+        lambda: model_id_consistency.iterDynamoDBEntries(
+          tableFactory=lambda: _FakeMetricTable(self.dynamodbItems,
+                                                self.scans),
+          totalSegments=totalSegments))
+    )
+
+
+  def testConsistentSources(self):
+    report = model_id_consistency.crossCheck(self._createSources(),
+                                             includeRepairPlan=True)
+
+    self.assertEqual(report["sources"], list(model_id_consistency.ALL_SOURCES))
+    self.assertEqual(report["numModels"], 25)
+    self.assertEqual(report["modelCounts"],
+                     dict((name, 25)
+                          for name in model_id_consistency.ALL_SOURCES))
+    self.assertEqual(report["numErrors"], 0)
+    self.assertEqual(report["numWarnings"], 0)
+    self.assertEqual(report["findings"], [])
+    self.assertEqual(report["repairPlan"], [])
+
+    # The report is JSON-serializable
+    json.dumps(report)
+
+    # Each segment was scanned once
+    self.assertItemsEqual(self.scans, [(0, 3), (1, 3), (2, 3)])
+
+
+  def testFindingsAndRepairPlan(self):
+    # Orphans of deleted metrics
+    self.checkpointIds.append("zzorphan")
+    self.inputQueueIds.append("zzorphan")
+    self.dynamodbItems.append(
+      _createDynamoDBItem(_createMetric("aaorphan", MetricStatus.ACTIVE)))
+
+    # Active models missing from other sources
+    self.checkpointIds.remove("uid001")
+    self.inputQueueIds.remove("uid002")
+    self.dynamodbItems = [item for item in self.dynamodbItems
+                          if item["uid"] != "uid003"]
+
+    # Attribute mismatch
+    self.dynamodbItems[4]["symbol"] = "WRONG"
+    mismatchedUid = self.dynamodbItems[4]["uid"]
+
+    # Unmonitored metric that still has a checkpoint and is in DynamoDB
+    self.metrics[10]["status"] = MetricStatus.UNMONITORED
+
+    # Model in error state that has nothing but a repository row
+    self.metrics[11]["status"] = MetricStatus.ERROR
+    self.checkpointIds.remove("uid011")
+    self.inputQueueIds.remove("uid011")
+    self.dynamodbItems = [item for item in self.dynamodbItems
+                          if item["uid"] != "uid011"]
+
+    report = model_id_consistency.crossCheck(self._createSources(),
+                                             includeRepairPlan=True)
+
+    self.assertEqual(report["numModels"], 27)
+
+    findings = sorted((finding["modelId"], finding["severity"],
+                       finding["kind"])
+                      for finding in report["findings"])
+    self.assertEqual(
+      findings,
+      sorted([
+        ("zzorphan", "error", "not_in_repository"),
+        ("aaorphan", "error", "not_in_repository"),
+        ("uid001", "error", "active_model_without_checkpoint"),
+        ("uid002", "error", "active_model_without_input_queue"),
+        ("uid003", "error", "active_model_not_in_dynamodb"),
+        (mismatchedUid, "error", "attribute_mismatch"),
+        ("uid010", "error", "inactive_model_in_dynamodb"),
+        ("uid010", "warning", "unmonitored_model_in_checkpoints"),
+        ("uid010", "warning", "unmonitored_model_in_input_queues"),
+        ("uid011", "warning", "model_in_error_state"),
+      ]))
+
+    self.assertEqual(report["numErrors"], 7)
+    self.assertEqual(report["numWarnings"], 3)
+    self.assertEqual(report["findingCounts"]["not_in_repository"], 2)
+
+    repairPlan = [RepairAction(**action) for action in report["repairPlan"]]
+    self.assertItemsEqual(
+      repairPlan,
+      [
+        RepairAction("zzorphan", "delete_checkpoint", "checkpoints"),
+        RepairAction("zzorphan", "delete_input_queue", "input_queues"),
+        RepairAction("aaorphan", "delete_dynamodb_metric", "dynamodb"),
+        RepairAction("uid001", "recreate_model", "checkpoints"),
+        RepairAction("uid002", "create_input_queue", "input_queues"),
+        RepairAction("uid003", "republish_to_dynamodb", "dynamodb"),
+        RepairAction(mismatchedUid, "republish_to_dynamodb", "dynamodb"),
+        RepairAction("uid010", "delete_dynamodb_metric", "dynamodb"),
+        RepairAction("uid010", "delete_checkpoint", "checkpoints"),
+        RepairAction("uid010", "delete_input_queue", "input_queues"),
+      ])
+    self.assertEqual(repairPlan,
+                     sorted(repairPlan,
+                            key=lambda action: (action.action, action.source,
+                                                action.modelId)))
+
+
+  def testSubsetOfSources(self):
+    self.checkpointIds.remove("uid001")
+    self.dynamodbItems.pop()
+
+    sources = self._createSources()
+    repositorySource, checkpointSource = sources[:2]
+
+    # Only sources that were read are expected to have the models
+    report = model_id_consistency.crossCheck([repositorySource,
+                                              checkpointSource])
+
+    self.assertEqual(report["sources"], ["repository", "checkpoints"])
+    self.assertEqual(
+      [(finding["modelId"], finding["kind"])
+       for finding in report["findings"]],
+      [("uid001", "active_model_without_checkpoint")])
+    self.assertNotIn("repairPlan", report)
+
+
+  def testRepositoryEntriesArePaged(self):
+    self._createSources()
+
+    queries = []
+    sql.event.listen(self.engine, "before_cursor_execute",
+                     lambda *args: queries.append(args[2]))
+
+    entries = list(model_id_consistency.iterRepositoryEntries(self.engine,
+                                                              pageSize=10))
+
+    self.assertEqual([uid for uid, _ in entries],
+                     sorted(metric["uid"] for metric in self.metrics))
+    self.assertEqual(entries[0][1]["status"], MetricStatus.ACTIVE)
+    # 3 pages of 10, 10 and 5 rows
+    self.assertEqual(len(queries), 3)
+
+
+  def testUnsortedSourceIsRejected(self):
+    source = ModelIdSource("unsorted", lambda: iter([("b", {}), ("a", {})]))
+
+    with self.assertRaises(ValueError):
+      list(model_id_consistency.iterModelPresence([source]))
+
+
+  def testMergePresence(self):
+    sources = [
+      ModelIdSource("s1", lambda: iter([("a", {"x": 1}), ("c", {})])),
+      ModelIdSource("s2", lambda: iter([("b", {}), ("c", {"y": 2})])),
+      ModelIdSource("s3", lambda: iter([]))
+    ]
+
+    self.assertEqual(
+      list(model_id_consistency.iterModelPresence(sources)),
+      [("a", {"s1": {"x": 1}}),
+       ("b", {"s2": {}}),
+       ("c", {"s1": {}, "s2": {"y": 2}})])
+
+
+
+if __name__ == "__main__":
+  unittest.main()
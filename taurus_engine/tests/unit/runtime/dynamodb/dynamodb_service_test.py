@@ -405,6 +405,68 @@ class DynamoDBServiceTestCase(unittest.TestCase):
       overwrite=True))
 
 
+  @patch.object(AnomalyService, "deserializeModelResult",
+                spec_set=AnomalyService.deserializeModelResult)
+  def testPrepareMessageWritesForModelInferenceResults(
+      self, deserializeModelResult, connectDynamoDB, _gracefulCreateTable):
+    """ Model inference results are decoded into a single write keyed by
+    metric uid, without writing anything yet
+    """
+    ackImpl = Mock()
+    message = amqp.messages.ConsumerMessage(
+      body=Mock(),
+      properties=Mock(headers=dict()),
+      methodInfo=amqp.messages.MessageDeliveryInfo(consumerTag=Mock(),
+                                                   deliveryTag=Mock(),
+                                                   redelivered=False,
+                                                   exchange=Mock(),
+                                                   routingKey=""),
+      ackImpl=ackImpl,
+      nackImpl=Mock())
+
+    hour = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    rows = [
+      dict(rowid=1, ts=epochFromNaiveUTCDatetime(hour), value=1.0,
+           rawAnomaly=0.1, anomaly=0.25),
+      dict(rowid=2, ts=epochFromNaiveUTCDatetime(hour) + 300, value=2.0,
+           rawAnomaly=0.1, anomaly=0.75)
+    ]
+
+    metricId = "3b035a5916994f2bb950f5717138f94b"
+
+    deserializeModelResult.return_value = dict(
+      metric=dict(
+        uid=metricId,
+        name="XIGNITE.AGN.VOLUME",
+        resource="Resource-of-XIGNITE.AGN.VOLUME",
+        spec=dict(
+          userInfo=dict(
+            symbol="AGN",
+            metricType="StockVolume",
+            metricTypeName="Stock Volume"
+          )
+        )
+      ),
+      results=rows
+    )
+
+    service = DynamoDBService()
+    writes = service._prepareMessageWrites(message)
+
+    self.assertEqual(len(writes), 1)
+    self.assertEqual(writes[0].partitionKey, metricId)
+    self.assertEqual(
+      writes[0].items,
+      [dynamodb_service.convertInferenceResultRowToMetricDataItem(
+        metricId, row)._asdict() for row in rows])
+    self.assertEqual(writes[0].hourlyScores,
+                     [("Resource-of-XIGNITE.AGN.VOLUME", "StockVolume", hour,
+                       0.75)])
+
+    self.assertFalse(service._metric_data.batch_write.called)
+    self.assertFalse(ackImpl.called)
+
+
   def testPublishMetricDataWithDuplicateKeys(self, connectDynamoDB,
                                              _gracefulCreateTable):
     """ Test for elimination of rows with duplicate keys by _publishMetricData
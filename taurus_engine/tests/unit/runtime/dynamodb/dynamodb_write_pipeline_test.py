@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Unit tests for taurus_engine.runtime.dynamodb.dynamodb_write_pipeline
+"""
+
+from datetime import datetime
+import threading
+import unittest
+
+from mock import Mock
+
+from taurus_engine import logging_support
+from taurus_engine.runtime.dynamodb.dynamodb_write_pipeline import (
+  CallableWrite,
+  DynamoDBWritePipeline,
+  MetricDataWrite,
+  WritePipelineError)
+
+
+
+def setUpModule():
+  logging_support.LoggingSupport.initTestApp()
+
+
+
+class _FakeWriter(object):
+  """ Records writes; blocks them while `gate` is clear """
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.gate = threading.Event()
+    self.gate.set()
+    self.batches = []
+    self.hourlyScores = []
+    self.failure = None
+
+
+  def writeMetricDataItems(self, items):
+    self.gate.wait()
+    if self.failure is not None:
+      raise self.failure
+    with self.lock:
+      self.batches.append(list(items))
+
+
+  def writeInstanceDataHourlyScore(self, instanceName, metricType, hour,
+                                   score):
+    with self.lock:
+      self.hourlyScores.append((instanceName, metricType, hour, score))
+
+
+
+def _metricDataWrite(uid, timestamps, hourlyScores=()):
+  return MetricDataWrite(
+    partitionKey=uid,
+    items=[{"uid": uid, "timestamp": ts, "metric_value": value}
+           for value, ts in enumerate(timestamps)],
+    hourlyScores=list(hourlyScores))
+
+
+
+class DynamoDBWritePipelineTestCase(unittest.TestCase):
+
+  def setUp(self):
+    self.writer = _FakeWriter()
+
+
+  def _createPipeline(self, numWorkers=3):
+    pipeline = DynamoDBWritePipeline(
+      numWorkers=numWorkers,
+      writeMetricDataItems=self.writer.writeMetricDataItems,
+      writeInstanceDataHourlyScore=self.writer.writeInstanceDataHourlyScore)
+    pipeline.start()
+    self.addCleanup(self.writer.gate.set)
+    return pipeline
+
+
+  def testAcksOnlyAfterWritesLand(self):
+    pipeline = self._createPipeline()
+    self.writer.gate.clear()
+
+    message = Mock()
+    pipeline.submit(message, [_metricDataWrite("a", ["t1", "t2"])])
+    pipeline.ackCompleted()
+
+    self.assertEqual(pipeline.numPending, 1)
+    self.assertFalse(message.ack.called)
+
+    self.writer.gate.set()
+    pipeline.drain()
+    pipeline.stop()
+
+    message.ack.assert_called_once_with()
+    self.assertEqual(pipeline.numPending, 0)
+    self.assertEqual(self.writer.batches,
+                     [[{"uid": "a", "timestamp": "t1", "metric_value": 0},
+                       {"uid": "a", "timestamp": "t2", "metric_value": 1}]])
+
+
+  def testMessageWithoutWritesIsAckedImmediately(self):
+    pipeline = self._createPipeline()
+
+    message = Mock()
+    pipeline.submit(message, [])
+
+    message.ack.assert_called_once_with()
+    self.assertEqual(pipeline.numPending, 0)
+    pipeline.stop()
+
+
+  def testCoalescesItemsAcrossMessagesPreservingPerMetricOrder(self):
+    pipeline = self._createPipeline()
+
+    # Hold the workers so that messages queue up behind the first ones
+    self.writer.gate.clear()
+
+    messages = []
+    for i in xrange(40):
+      for uid in ("a", "b", "c", "d"):
+        message = Mock()
+        messages.append(message)
+        pipeline.submit(message, [_metricDataWrite(uid, ["%s-%03d" % (uid, i)])])
+
+    self.writer.gate.set()
+    pipeline.drain()
+    pipeline.stop()
+
+    for message in messages:
+      message.ack.assert_called_once_with()
+
+    # Each metric's items were written in order
+    for uid in ("a", "b", "c", "d"):
+      timestamps = [item["timestamp"]
+                    for batch in self.writer.batches
+                    for item in batch if item["uid"] == uid]
+      self.assertEqual(timestamps, ["%s-%03d" % (uid, i) for i in xrange(40)])
+
+    # Queued-up messages were coalesced into fewer, larger writes
+    self.assertLess(len(self.writer.batches), len(messages) / 2)
+
+
+  def testDuplicateKeysAcrossMessages(self):
+    pipeline = self._createPipeline(numWorkers=1)
+    self.writer.gate.clear()
+
+    pipeline.submit(Mock(), [_metricDataWrite("a", ["t0"])])
+    first = _metricDataWrite("a", ["t1", "t2"])
+    second = MetricDataWrite(
+      partitionKey="a",
+      items=[{"uid": "a", "timestamp": "t2", "metric_value": 99}],
+      hourlyScores=[])
+    pipeline.submit(Mock(), [first])
+    pipeline.submit(Mock(), [second])
+
+    self.writer.gate.set()
+    pipeline.drain()
+    pipeline.stop()
+
+    items = [item for batch in self.writer.batches for item in batch]
+    self.assertEqual(
+      [(item["timestamp"], item["metric_value"]) for item in items],
+      [("t0", 0), ("t1", 0), ("t2", 99)])
+
+
+  def testMergesHourlyScores(self):
+    pipeline = self._createPipeline(numWorkers=1)
+    self.writer.gate.clear()
+
+    hour = datetime(2015, 2, 20, 1)
+    pipeline.submit(Mock(), [_metricDataWrite("a", ["t0"])])
+    pipeline.submit(Mock(), [_metricDataWrite(
+      "a", ["t1"], [("instance", "StockVolume", hour, 0.5)])])
+    pipeline.submit(Mock(), [_metricDataWrite(
+      "a", ["t2"], [("instance", "StockVolume", hour, 0.75)])])
+    pipeline.submit(Mock(), [_metricDataWrite(
+      "a", ["t3"], [("instance", "StockVolume", hour, 0.25)])])
+
+    self.writer.gate.set()
+    pipeline.drain()
+    pipeline.stop()
+
+    self.assertEqual(self.writer.hourlyScores,
+                     [("instance", "StockVolume", hour, 0.75)])
+
+
+  def testCallableWritesRunInOrderWithMetricData(self):
+    pipeline = self._createPipeline(numWorkers=1)
+    events = []
+
+    def callback():
+      with self.writer.lock:
+        events.append(
+          ("callable", sum(len(batch) for batch in self.writer.batches)))
+
+    self.writer.gate.clear()
+    pipeline.submit(Mock(), [_metricDataWrite("a", ["t0"])])
+    pipeline.submit(Mock(), [_metricDataWrite("a", ["t1"])])
+    message = Mock()
+    pipeline.submit(message, [CallableWrite(partitionKey="a", fn=callback)])
+    pipeline.submit(Mock(), [_metricDataWrite("a", ["t2"])])
+
+    self.writer.gate.set()
+    pipeline.drain()
+    pipeline.stop()
+
+    # The callable ran after both preceding writes of its partition
+    self.assertEqual(events, [("callable", 2)])
+    message.ack.assert_called_once_with()
+
+
+  def testWorkerFailureIsReportedAndMessageIsNotAcked(self):
+    pipeline = self._createPipeline()
+    self.writer.failure = RuntimeError("write failed")
+
+    message = Mock()
+    pipeline.submit(message, [_metricDataWrite("a", ["t1"])])
+
+    with self.assertRaises(WritePipelineError):
+      pipeline.drain()
+
+    self.assertFalse(message.ack.called)
+
+    with self.assertRaises(WritePipelineError):
+      pipeline.submit(Mock(), [_metricDataWrite("a", ["t2"])])
+
+    pipeline.stop()
+
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Unit tests for taurus_engine.runtime.dynamodb.instance_data_hourly_cache
+"""
+
+from datetime import datetime, timedelta
+import random
+import threading
+import time
+import unittest
+
+from boto.dynamodb2.exceptions import (ConditionalCheckFailedException,
+                                       ValidationException)
+from mock import Mock, patch
+
+from taurus_engine import logging_support
+from taurus_engine.runtime.dynamodb.dynamodb_service import DynamoDBService
+from taurus_engine.runtime.dynamodb.instance_data_hourly_cache import (
+  InstanceDataHourlyCache,
+  InstanceDataHourlyCacheStats)
+
+
+
+def setUpModule():
+  logging_support.LoggingSupport.initTestApp()
+
+
+
+class _InstanceDataHourlyConnectionStandIn(object):
+  """ Stand-in for the dynamodb connection that implements the conditional
+  `update_item()` and `put_item()` requests issued by
+  `DynamoDBService._putInstanceDataHourlyScore()`
+  """
+
+  def __init__(self):
+    self.items = {}
+    self.numRequests = 0
+
+
+  def update_item(self, table_name, key, update_expression,
+                  condition_expression, expression_attribute_values):
+    self.numRequests += 1
+    metricType = update_expression.split()[1].split(".", 1)[1]
+    value = expression_attribute_values[":value"]["N"]
+
+    item = self.items.get((key["instance_id"]["S"], key["date_hour"]["S"]))
+    if item is None:
+      raise ValidationException(400, "The document path provided in the "
+                                "update expression is invalid for update")
+
+    scores = item["anomaly_score"]["M"]
+    if (metricType in scores and
+        float(scores[metricType]["N"]) >= float(value)):
+      raise ConditionalCheckFailedException(400, "condition failed")
+    scores[metricType] = {"N": value}
+
+
+  def put_item(self, table_name, item, condition_expression):
+    self.numRequests += 1
+    key = (item["instance_id"]["S"], item["date_hour"]["S"])
+    if key in self.items:
+      raise ConditionalCheckFailedException(400, "condition failed")
+    self.items[key] = item
+
+
+  def getScores(self):
+    return dict(
+      ((instanceId, dateHour, metricType), float(score["N"]))
+      for (instanceId, dateHour), item in self.items.iteritems()
+      for metricType, score in item["anomaly_score"]["M"].iteritems())
+
+
+
+class _FakeClock(object):
+  def __init__(self):
+    self.now = 1000.0
+
+
+  def __call__(self):
+    return self.now
+
+
+
+def _createService(connection):
+  """ :returns: DynamoDBService writing to the given connection stand-in """
+  with patch.object(DynamoDBService, "connectDynamoDB",
+                    return_value=connection), \
+      patch.object(DynamoDBService, "_gracefulCreateTable",
+                   side_effect=lambda definition: Mock(
+                     table_name=definition.tableName)):
+    return DynamoDBService()
+
+
+
+class InstanceDataHourlyCacheTestCase(unittest.TestCase):
+
+  def setUp(self):
+    self.writeScore = Mock()
+    self.clock = _FakeClock()
+    self.cache = InstanceDataHourlyCache(writeScore=self.writeScore,
+                                         maxStalenessSec=30,
+                                         clock=self.clock)
+    self.hour = datetime(2015, 2, 20, 1)
+
+
+  def testScoresThatDontIncreaseAreNotWritten(self):
+    for score in (0.5, 0.25, 0.75, 0.5, 0.75):
+      self.cache.update("AAPL", "StockVolume", self.hour, score)
+
+    self.assertFalse(self.writeScore.called)
+
+    self.cache.flush()
+
+    self.writeScore.assert_called_once_with("AAPL", "StockVolume", self.hour,
+                                            0.75)
+    self.assertEqual(
+      self.cache.getStats(),
+      InstanceDataHourlyCacheStats(numUpdates=5, numWrites=1,
+                                   numWritesAvoided=4))
+
+    # Already saved
+    self.cache.update("AAPL", "StockVolume", self.hour, 0.75)
+    self.cache.flush()
+    self.assertEqual(self.writeScore.call_count, 1)
+
+
+  def testHourRolloverWritesPreviousHour(self):
+    nextHour = self.hour + timedelta(hours=1)
+
+    self.cache.update("AAPL", "StockVolume", self.hour, 0.5)
+    self.cache.update("AAPL", "StockVolume", self.hour, 0.6)
+    self.cache.update("AAPL", "StockPrice", nextHour, 0.1)
+    self.assertFalse(self.writeScore.called)
+
+    self.cache.update("AAPL", "StockVolume", nextHour, 0.2)
+    self.writeScore.assert_called_once_with("AAPL", "StockVolume", self.hour,
+                                            0.6)
+
+
+  def testOutOfOrderHourIsWrittenThrough(self):
+    self.cache.update("AAPL", "StockVolume", self.hour, 0.5)
+    earlierHour = self.hour - timedelta(hours=1)
+
+    self.cache.update("AAPL", "StockVolume", earlierHour, 0.1)
+    self.writeScore.assert_called_once_with("AAPL", "StockVolume",
+                                            earlierHour, 0.1)
+
+
+  def testFlushStaleWritesOnlyScoresPendingForMaxStaleness(self):
+    self.cache.update("AAPL", "StockVolume", self.hour, 0.5)
+    self.clock.now += 20
+    self.cache.update("AAPL", "StockPrice", self.hour, 0.5)
+    # Raising an already-pending score doesn't reset its staleness
+    self.cache.update("AAPL", "StockVolume", self.hour, 0.6)
+
+    self.clock.now += 10
+    self.cache.flushStale()
+    self.writeScore.assert_called_once_with("AAPL", "StockVolume", self.hour,
+                                            0.6)
+
+    self.writeScore.reset_mock()
+    self.clock.now += 20
+    self.cache.flushStale()
+    self.writeScore.assert_called_once_with("AAPL", "StockPrice", self.hour,
+                                            0.5)
+
+
+  def testFailedWriteIsRetriedOnNextFlush(self):
+    self.cache.update("AAPL", "StockVolume", self.hour, 0.5)
+
+    self.writeScore.side_effect = RuntimeError("throttled")
+    with self.assertRaises(RuntimeError):
+      self.cache.flush()
+
+    self.writeScore.side_effect = None
+    self.writeScore.reset_mock()
+    self.cache.flush()
+    self.writeScore.assert_called_once_with("AAPL", "StockVolume", self.hour,
+                                            0.5)
+
+
+  def testFailedRolloverWriteIsRetriedOnNextFlush(self):
+    nextHour = self.hour + timedelta(hours=1)
+    self.cache.update("AAPL", "StockVolume", self.hour, 0.5)
+
+    self.writeScore.side_effect = RuntimeError("throttled")
+    with self.assertRaises(RuntimeError):
+      self.cache.update("AAPL", "StockVolume", nextHour, 0.2)
+
+    self.writeScore.side_effect = None
+    self.writeScore.reset_mock()
+    self.cache.flush()
+    self.assertItemsEqual(
+      self.writeScore.call_args_list,
+      [(("AAPL", "StockVolume", self.hour, 0.5),),
+       (("AAPL", "StockVolume", nextHour, 0.2),)])
+
+
+  def testFailedOutOfOrderWriteIsRetriedOnNextFlush(self):
+    earlierHour = self.hour - timedelta(hours=1)
+    self.cache.update("AAPL", "StockVolume", self.hour, 0.5)
+    self.cache.flush()
+
+    self.writeScore.side_effect = RuntimeError("throttled")
+    with self.assertRaises(RuntimeError):
+      self.cache.update("AAPL", "StockVolume", earlierHour, 0.1)
+
+    self.writeScore.side_effect = None
+    self.writeScore.reset_mock()
+    self.cache.flushStale()
+    self.writeScore.assert_called_once_with("AAPL", "StockVolume",
+                                            earlierHour, 0.1)
+
+    self.writeScore.reset_mock()
+    self.cache.flush()
+    self.assertFalse(self.writeScore.called)
+
+
+  def testBackgroundFlusherBoundsStaleness(self):
+    written = threading.Event()
+    cache = InstanceDataHourlyCache(
+      writeScore=lambda *args: written.set(),
+      maxStalenessSec=0.1)
+    cache.start()
+    try:
+      cache.update("AAPL", "StockVolume", self.hour, 0.5)
+      self.assertTrue(written.wait(5))
+    finally:
+      cache.stop()
+
+
+  def testStopWritesPendingScores(self):
+    self.cache.start()
+    self.cache.update("AAPL", "StockVolume", self.hour, 0.5)
+    self.cache.stop()
+
+    self.writeScore.assert_called_once_with("AAPL", "StockVolume", self.hour,
+                                            0.5)
+
+
+  def testReplayMatchesWriteThroughWithFewerRequests(self):
+    rng = random.Random(42)
+    start = datetime(2015, 2, 20)
+    updates = []
+    for instanceName in ("AAPL", "GOOG"):
+      for metricType in ("StockVolume", "StockPrice", "TwitterVolume"):
+        for i in xrange(36):
+          # 5-minute samples over 3 hours
+          ts = start + timedelta(minutes=5 * i)
+          updates.append((instanceName, metricType, ts.replace(minute=0),
+                          round(rng.random(), 4)))
+    rng.shuffle(updates)
+    updates.sort(key=lambda update: update[2])
+
+    writeThroughConnection = _InstanceDataHourlyConnectionStandIn()
+    service = _createService(writeThroughConnection)
+    for update in updates:
+      service._putInstanceDataHourlyScore(*update)
+
+    cachedConnection = _InstanceDataHourlyConnectionStandIn()
+    service = _createService(cachedConnection)
+    cache = InstanceDataHourlyCache(
+      writeScore=service._putInstanceDataHourlyScore,
+      maxStalenessSec=30,
+      clock=self.clock)
+    for update in updates:
+      cache.update(*update)
+      self.clock.now += 1
+    cache.flush()
+
+    self.assertEqual(cachedConnection.getScores(),
+                     writeThroughConnection.getScores())
+    self.assertEqual(len(cachedConnection.getScores()), 2 * 3 * 3)
+
+    stats = cache.getStats()
+    self.assertEqual(stats.numUpdates, len(updates))
+    self.assertEqual(stats.numWrites + stats.numWritesAvoided, len(updates))
+    self.assertLess(cachedConnection.numRequests,
+                    writeThroughConnection.numRequests / 3)
+
+
+
+if __name__ == "__main__":
+  unittest.main()
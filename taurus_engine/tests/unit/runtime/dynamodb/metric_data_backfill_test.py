@@ -0,0 +1,294 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Unit tests for taurus_engine.runtime.dynamodb.metric_data_backfill against a
+SQLite repository and local stand-ins for the message bus and DynamoDB
+"""
+
+from datetime import datetime, timedelta
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import sqlalchemy as sql
+from sqlalchemy.dialects.mysql import DOUBLE
+from sqlalchemy.ext.compiler import compiles
+
+from htmengine.runtime.anomaly_service import AnomalyService
+
+from taurus_engine import logging_support
+from taurus_engine.repository import schema
+from taurus_engine.runtime.dynamodb.metric_data_backfill import (
+  CountMismatch,
+  MetricDataBackfill)
+
+
+
+@compiles(DOUBLE, "sqlite")
+def _compileDoubleForSQLite(_type, _compiler, **_kw):
+  return "REAL"
+
+
+
+def setUpModule():
+  logging_support.LoggingSupport.initTestApp()
+
+
+
+class _PublishError(Exception):
+  pass
+
+
+
+class _FakeDynamoDB(object):
+  """ Stand-in for the dynamodb service and its metric_data table: consumes
+  the published messages and keeps one item per metric and timestamp
+  """
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.metrics = set()
+    self.items = {}
+    self.numMessages = 0
+    self.batchSizes = []
+    self.rowidsByMetric = {}
+    # Fail publishing after this many messages; None to never fail
+    self.failAfter = None
+
+
+  def publishExg(self, exchange, routingKey, body, properties):
+    with self.lock:
+      if self.failAfter is not None and self.numMessages >= self.failAfter:
+        raise _PublishError("Test publish failure")
+
+      self.numMessages += 1
+      message = AnomalyService.deserializeModelResult(body)
+
+      if "method" in message:
+        self.metrics.add(message["modelId"])
+        return
+
+      uid = message["metric"]["uid"]
+      self.batchSizes.append(len(message["results"]))
+      for row in message["results"]:
+        self.items[(uid, datetime.utcfromtimestamp(row["ts"]))] = row
+        self.rowidsByMetric.setdefault(uid, []).append(row["rowid"])
+
+
+  def countRows(self, uid, fromTimestamp):
+    with self.lock:
+      return sum(1 for (itemUid, timestamp) in self.items
+                 if itemUid == uid and timestamp >= fromTimestamp)
+
+
+
+class _FakeMessageBus(object):
+
+  def __init__(self, dynamodb):
+    self._dynamodb = dynamodb
+
+
+  def __enter__(self):
+    return self
+
+
+  def __exit__(self, *args):
+    return False
+
+
+  def publishExg(self, exchange, routingKey, body, properties=None):
+    self._dynamodb.publishExg(exchange, routingKey, body, properties)
+
+
+
+class MetricDataBackfillTestCase(unittest.TestCase):
+
+  NUM_METRICS = 3
+  NUM_ROWS = 450
+
+
+  def setUp(self):
+    self.tempDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tempDir)
+    self.checkpointPath = os.path.join(self.tempDir, "checkpoint.json")
+
+    self.engine = sql.create_engine(
+      "sqlite:///%s" % (os.path.join(self.tempDir, "repository.db"),),
+      connect_args={"timeout": 60})
+    self.addCleanup(self.engine.dispose)
+    schema.metadata.create_all(self.engine,
+                               tables=[schema.metric, schema.metric_data])
+
+    self.dynamodb = _FakeDynamoDB()
+
+    now = datetime.utcnow().replace(microsecond=0)
+    self.expectedRowids = {}
+
+    metricRows = []
+    dataRows = []
+    for i in xrange(self.NUM_METRICS):
+      uid = "uid%d" % (i,)
+      metricRows.append(dict(
+        uid=uid,
+        datasource="custom",
+        name="METRIC.%d" % (i,),
+        description="Metric %d" % (i,),
+        server="Company %d" % (i,),
+        location="",
+        parameters=json.dumps({
+          "datasource": "custom",
+          "metricSpec": {"metric": "METRIC.%d" % (i,),
+                         "resource": "Company %d" % (i,),
+                         "userInfo": {"metricType": "StockVolume",
+                                      "metricTypeName": "Stock Volume",
+                                      "symbol": "SYM%d" % (i,)}}})))
+
+      start = now - timedelta(days=15)
+      for rowid in xrange(1, self.NUM_ROWS + 1):
+        timestamp = start + timedelta(minutes=5 * rowid)
+        inWindow = timestamp >= now - timedelta(days=14)
+        # Every 10th row is not scored yet
+        scored = rowid % 10 != 0
+        dataRows.append(dict(
+          uid=uid,
+          rowid=rowid,
+          timestamp=timestamp,
+          metric_value=float(rowid),
+          raw_anomaly_score=0.5 if scored else None,
+          anomaly_score=0.25 if scored else None,
+          display_value=0))
+        if inWindow and scored:
+          self.expectedRowids.setdefault(uid, []).append(rowid)
+
+    # A metric without data
+    metricRows.append(dict(uid="nodata", datasource="custom", name="NODATA",
+                           description="", server="", location="",
+                           parameters="{}"))
+
+    self.engine.execute(schema.metric.insert(), metricRows)
+    self.engine.execute(schema.metric_data.insert(), dataRows)
+
+
+  def _createBackfill(self, **kwargs):
+    params = dict(engine=self.engine,
+                  messageBusFactory=lambda: _FakeMessageBus(self.dynamodb),
+                  checkpointPath=self.checkpointPath,
+                  numWorkers=2,
+                  batchSize=50,
+                  pageSize=120,
+                  maxMessagesPerSec=0)
+    params.update(kwargs)
+    backfill = MetricDataBackfill(**params)
+    self.addCleanup(backfill.close)
+    return backfill
+
+
+  def testBackfillPublishesAllRowsInBatches(self):
+    backfill = self._createBackfill()
+
+    stats = backfill.run()
+
+    numExpectedRows = sum(len(rowids)
+                          for rowids in self.expectedRowids.itervalues())
+    self.assertGreater(numExpectedRows, 0)
+    self.assertEqual(stats.numMetrics, self.NUM_METRICS)
+    self.assertEqual(stats.numRows, numExpectedRows)
+
+    self.assertEqual(self.dynamodb.metrics, set(self.expectedRowids))
+    self.assertEqual(self.dynamodb.rowidsByMetric, self.expectedRowids)
+    self.assertLessEqual(max(self.dynamodb.batchSizes), 50)
+
+    self.assertEqual(backfill.verify(self.dynamodb.countRows), [])
+
+    # A completed backfill has nothing left to do
+    numMessages = self.dynamodb.numMessages
+    stats = self._createBackfill().run()
+    self.assertEqual(stats.numMetrics, 0)
+    self.assertEqual(self.dynamodb.numMessages, numMessages)
+
+
+  def testResumeAfterInterruption(self):
+    self.dynamodb.failAfter = 7
+
+    backfill = self._createBackfill()
+    fromTimestamp = backfill.fromTimestamp
+    with self.assertRaises(_PublishError):
+      backfill.run()
+    backfill.close()
+
+    numPublishedRows = len(self.dynamodb.items)
+    self.assertGreater(numPublishedRows, 0)
+
+    self.dynamodb.failAfter = None
+    self.dynamodb.rowidsByMetric.clear()
+
+    resumed = self._createBackfill()
+    self.assertEqual(resumed.fromTimestamp, fromTimestamp)
+    stats = resumed.run()
+
+    # Only the rows that were not published before the failure are published
+    numExpectedRows = sum(len(rowids)
+                          for rowids in self.expectedRowids.itervalues())
+    self.assertEqual(stats.numRows, numExpectedRows - numPublishedRows)
+    for uid, rowids in self.dynamodb.rowidsByMetric.iteritems():
+      self.assertEqual(rowids, self.expectedRowids[uid][-len(rowids):])
+
+    self.assertEqual(len(self.dynamodb.items), numExpectedRows)
+    self.assertEqual(resumed.verify(self.dynamodb.countRows), [])
+
+
+  def testVerifyReportsCountMismatches(self):
+    backfill = self._createBackfill()
+    backfill.run()
+
+    # Lose a row of one metric at the destination
+    lostKey = sorted(key for key in self.dynamodb.items if key[0] == "uid1")[3]
+    del self.dynamodb.items[lostKey]
+
+    sourceCount = len(self.expectedRowids["uid1"])
+    self.assertEqual(backfill.verify(self.dynamodb.countRows),
+                     [CountMismatch(uid="uid1",
+                                    sourceCount=sourceCount,
+                                    destinationCount=sourceCount - 1)])
+
+
+  def testPublishingIsThrottled(self):
+    backfill = self._createBackfill(batchSize=100, pageSize=1000,
+                                    maxMessagesPerSec=100)
+
+    start = time.time()
+    backfill.run(metricIds=["uid0"])
+    duration = time.time() - start
+
+    # A defineModel command and two batches
+    self.assertGreater(len(self.expectedRowids["uid0"]), 100)
+    self.assertEqual(self.dynamodb.numMessages, 3)
+    self.assertGreaterEqual(duration, 0.02)
+
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -20,6 +20,8 @@ setup(
        "%s.twitterdirect.process_tweet_deletions:main" % name),
       ("taurus-purge-old-tweets = "
        "%s.twitterdirect.purge_old_tweets:main" % name),
+      ("taurus-reconcile-tweet-volumes = "
+       "%s.twitterdirect.reconcile_tweet_volumes:main" % name),
       ("taurus-set-collectorsdb-login = "
        "%s.collectorsdb.set_collectorsdb_login:main" % name),
       ("taurus-reset-collectorsdb = "
@@ -303,6 +303,37 @@ Index("stored_at_idx", twitterTweetSamples.c.stored_at)
 
 
 
+# Number of tweets per tweet volume metric and aggregation interval; maintained
+# together with twitter_tweet_samples by the twitter agent
+twitterTweetVolume = Table(
+  "twitter_tweet_volume",
+  metadata,
+
+  # Aggregation timestamp
+  Column("agg_ts",
+         DATETIME(),
+         nullable=False),
+
+  # Metric name
+  Column("metric",
+         mysql.VARCHAR(length=METRIC_NAME_MAX_LEN),
+         nullable=False),
+
+  PrimaryKeyConstraint("agg_ts", "metric",
+                       name="twitter_tweet_volume_pk"),
+
+  # Number of twitter_tweet_samples rows with the given metric and agg_ts
+  Column("num_tweets",
+         mysql.INTEGER(unsigned=True),
+         nullable=False,
+         server_default="0"),
+
+  mysql_COLLATE=MYSQL_COLLATE,
+  mysql_CHARSET=MYSQL_CHARSET,
+)
+
+
+
 # Tweet IDs to be deleted from Status deletion notices; see
 # https://dev.twitter.com/streaming/overview/messages-types
 # NOTE: per twitter doc, deletion notices may arrive prior to the
@@ -25,7 +25,7 @@ from optparse import OptionParser
 import os
 import sys
 
-from taurus_metric_collectors import logging_support, metric_utils
+from taurus_metric_collectors import logging_support, model_bootstrap
 
 
 
@@ -39,7 +39,8 @@ g_log = logging.getLogger("metric_collectors.create_models")
 
 def _parseArgs():
   """
-  :returns: dict of arg names and values: htmServer, apiKey
+  :returns: dict of arg names and values: htmServer, apiKey, concurrency,
+    bulkSize, resumePath
   """
   helpString = (
     "%prog [options]"
@@ -64,6 +65,30 @@ def _parseArgs():
     dest="apiKey",
     help="API Key of HTM Engine to create models [default: %default]")
 
+  parser.add_option(
+    "--concurrency",
+    action="store",
+    type="int",
+    dest="concurrency",
+    default=model_bootstrap.DEFAULT_CONCURRENCY,
+    help="Max number of model creation requests in flight [default: %default]")
+
+  parser.add_option(
+    "--bulk-size",
+    action="store",
+    type="int",
+    dest="bulkSize",
+    default=model_bootstrap.DEFAULT_BULK_SIZE,
+    help="Number of models to create per request [default: %default]")
+
+  parser.add_option(
+    "--resume-file",
+    action="store",
+    type="string",
+    dest="resumePath",
+    help="Path of file recording created models; models recorded by an "
+    "earlier run are skipped [default: %default]")
+
   options, remainingArgs = parser.parse_args()
   if remainingArgs:
     msg = "Unexpected remaining args: %r" % (remainingArgs,)
@@ -81,10 +106,23 @@ def _parseArgs():
     g_log.error(msg)
     parser.error(msg)
 
+  if options.concurrency < 1:
+    msg = "--concurrency must be positive, but got %r" % (options.concurrency,)
+    g_log.error(msg)
+    parser.error(msg)
+
+  if options.bulkSize < 1:
+    msg = "--bulk-size must be positive, but got %r" % (options.bulkSize,)
+    g_log.error(msg)
+    parser.error(msg)
+
 
   return dict(
     htmServer=options.htmServer,
-    apiKey=options.apiKey)
+    apiKey=options.apiKey,
+    concurrency=options.concurrency,
+    bulkSize=options.bulkSize,
+    resumePath=options.resumePath)
 
 
 
@@ -95,7 +133,17 @@ def main():
     options = _parseArgs()
     g_log.info("Running %s with options=%r", sys.argv[0], options)
 
-    metric_utils.createAllModels(options["htmServer"], options["apiKey"])
+    result = model_bootstrap.bootstrapAllModels(
+      options["htmServer"],
+      options["apiKey"],
+      concurrency=options["concurrency"],
+      bulkSize=options["bulkSize"],
+      resumePath=options["resumePath"])
+
+    if result.failedMetricNames:
+      g_log.error("Failed to create models for %d metrics: %s",
+                  len(result.failedMetricNames), result.failedMetricNames)
+      sys.exit(1)
   except SystemExit as e:
     if e.code != 0:
       g_log.exception("create_models failed")
@@ -258,7 +258,29 @@ def createCustomHtmModel(host,
   :raises: ModelMonitorRequestError for non-specific error in request
   :raises: RetriesExceededError if retries were exceeded
   """
-  modelParams = {
+  modelParams = createCustomModelSpec(metricName=metricName,
+                                      resourceName=resourceName,
+                                      userInfo=userInfo,
+                                      modelParams=modelParams)
+
+  return createHtmModel(host=host, apiKey=apiKey, modelParams=modelParams)
+
+
+
+def createCustomModelSpec(metricName, resourceName, userInfo, modelParams):
+  """ Create the model spec of a custom metric per _models POST API
+
+  :param metricName: Name of the metric
+  :param resourceName: Name of the resource with which the metric is associated
+  :param userInfo: A dict containing custom user info to be included in
+    metricSpec
+  :param modelParams: A dict containing custom model params to be included in
+    modelSpec
+
+  :returns: model spec
+  :rtype: dict
+  """
+  return {
     "datasource": "custom",
     "metricSpec": {
       "metric": metricName,
@@ -268,33 +290,25 @@ def createCustomHtmModel(host,
     "modelParams": modelParams
   }
 
-  return createHtmModel(host=host, apiKey=apiKey, modelParams=modelParams)
-
 
 
-def createAllModels(host, apiKey, onlyMetricNames=None):
-  """ Create models corresponding to all metrics in the metrics configuration.
+def getCustomModelSpecs(metricsConfig, onlyMetricNames=None):
+  """ Create the model specs of metrics in the metrics configuration
 
-  NOTE: Has no effect on metrics that have already been promoted to models.
-
-  :param str host: API server's hostname or IP address
-  :param str apiKey: API server's API Key
-  :param onlyMetricNames: None to create models for all configured metrics; an
-    iterable of metric names to limit creation of models only to metrics with
-    those names - the metric names in the iterable MUST be a non-empty subset of
-    the configured metrics.
+  :param dict metricsConfig: metrics configuration as returned by
+    `getMetricsConfiguration()`
+  :param onlyMetricNames: None for all configured metrics; an iterable of
+    metric names to limit the model specs only to metrics with those names -
+    the metric names in the iterable MUST be a non-empty subset of the
+    configured metrics.
   :type onlyMetricNames: None or iterable
 
-  :returns: List of models that were created; each element is a model info
-    dictionary from the successful result of the _models POST request
+  :returns: model specs per `createCustomModelSpec()` in the order of the
+    metrics configuration
   :rtype: list of dicts
 
-  :raises: ModelQuotaExceededError if quota limit was exceeded
-  :raises: ModelMonitorRequestError for non-specific error in request
-  :raises: RetriesExceededError if retries were exceeded
+  :raises ValueError: if onlyMetricNames is empty or has unknown metric names
   """
-  metricsConfig = getMetricsConfiguration()
-
   configuredMetricNames = set(getMetricNamesFromConfig(metricsConfig))
 
   if onlyMetricNames is not None:
@@ -318,40 +332,78 @@ def createAllModels(host, apiKey, onlyMetricNames=None):
   else:
     onlyMetricNames = configuredMetricNames
 
-  allModels = []
+  modelSpecs = []
 
-  i = 0
   for resName, resVal in metricsConfig.iteritems():
     for metricName, metricVal in resVal["metrics"].iteritems():
 
       if metricName not in onlyMetricNames:
         continue
 
-      i += 1
-
       userInfo = {
         "metricType": metricVal["metricType"],
         "metricTypeName": metricVal["metricTypeName"],
         "symbol": resVal["symbol"]
       }
 
-      modelParams = metricVal.get("modelParams", {})
+      modelSpecs.append(
+        createCustomModelSpec(metricName=metricName,
+                              resourceName=resName,
+                              userInfo=userInfo,
+                              modelParams=metricVal.get("modelParams", {})))
+
+  return modelSpecs
+
+
+
+def createAllModels(host, apiKey, onlyMetricNames=None):
+  """ Create models corresponding to all metrics in the metrics configuration.
+
+  NOTE: Has no effect on metrics that have already been promoted to models.
+
+  :param str host: API server's hostname or IP address
+  :param str apiKey: API server's API Key
+  :param onlyMetricNames: None to create models for all configured metrics; an
+    iterable of metric names to limit creation of models only to metrics with
+    those names - the metric names in the iterable MUST be a non-empty subset of
+    the configured metrics.
+  :type onlyMetricNames: None or iterable
+
+  :returns: List of models that were created; each element is a model info
+    dictionary from the successful result of the _models POST request
+  :rtype: list of dicts
 
-      try:
-        model = createCustomHtmModel(host=host,
-                                     apiKey=apiKey,
-                                     metricName=metricName,
-                                     resourceName=resName,
-                                     userInfo=userInfo,
-                                     modelParams=modelParams)
-      except ModelQuotaExceededError as e:
-        g_log.error("Model quota exceeded: %r", e)
-        raise
+  :raises: ModelQuotaExceededError if quota limit was exceeded
+  :raises: ModelMonitorRequestError for non-specific error in request
+  :raises: RetriesExceededError if retries were exceeded
+  :raises: ValueError if onlyMetricNames is invalid
+
+  See `taurus_metric_collectors.model_bootstrap` for creating many models
+  concurrently.
+  """
+  modelSpecs = getCustomModelSpecs(getMetricsConfiguration(),
+                                   onlyMetricNames=onlyMetricNames)
+
+  allModels = []
+
+  for i, modelSpec in enumerate(modelSpecs, start=1):
+    metricSpec = modelSpec["metricSpec"]
+
+    try:
+      model = createCustomHtmModel(host=host,
+                                   apiKey=apiKey,
+                                   metricName=metricSpec["metric"],
+                                   resourceName=metricSpec["resource"],
+                                   userInfo=metricSpec["userInfo"],
+                                   modelParams=modelSpec["modelParams"])
+    except ModelQuotaExceededError as e:
+      g_log.error("Model quota exceeded: %r", e)
+      raise
 
-      g_log.info("Enabled monitoring of metric=%s; uid=%s (%d of %d)",
-                 model["name"], model["uid"], i, len(onlyMetricNames))
+    g_log.info("Enabled monitoring of metric=%s; uid=%s (%d of %d)",
+               model["name"], model["uid"], i, len(modelSpecs))
 
-      allModels.append(model)
+    allModels.append(model)
 
   return allModels
 
@@ -719,11 +771,12 @@ _METRIC_DATA_BATCH_WRITE_SIZE = 200
 
 
 @contextlib.contextmanager
-def metricDataBatchWrite(log):
+def metricDataBatchWrite(log, batchSize=_METRIC_DATA_BATCH_WRITE_SIZE):
   """ Context manager for sending metric data samples more efficiently using
   batches.
 
   :param log: logger object for logging
+  :param int batchSize: maximum number of samples per batch
 
   On entry, it yields a callable putSample for putting metric data samples:
 
@@ -765,7 +818,7 @@ def metricDataBatchWrite(log):
     # NOTE: we cast value to float to deal with values like the long 72001L that
     #   would fail the parsing back to float in the receiver.
     batch.append("%s %r %d" % (metricName, float(value), epochTimestamp))
-    if len(batch) >= _METRIC_DATA_BATCH_WRITE_SIZE:
+    if len(batch) >= batchSize:
       sendBatch()
 
 
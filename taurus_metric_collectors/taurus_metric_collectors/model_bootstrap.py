@@ -0,0 +1,443 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Concurrent creation of many Taurus models via the _models POST API.
+
+Each model creation request blocks on the server while the metric's backlog is
+set up, so creating the models one after another takes hours for a few
+thousand metrics. `ModelBootstrapper` keeps a bounded number of requests in
+flight, retries transient failures with exponential backoff, logs progress, and
+records every created model in a resume file so that an interrupted bootstrap
+picks up where it left off. The _models POST API also accepts a list of model
+specs; with bulkSize > 1, the specs are sent in chunks of that size, falling
+back to one request per model when a chunk is rejected.
+"""
+
+from collections import namedtuple
+import json
+import logging
+import os
+import Queue
+import threading
+import time
+
+import requests
+
+from taurus_metric_collectors import metric_utils
+from taurus_metric_collectors.metric_utils import (ModelMonitorRequestError,
+                                                   ModelQuotaExceededError,
+                                                   RetriesExceededError)
+
+
+
+DEFAULT_CONCURRENCY = 8
+
+DEFAULT_BULK_SIZE = 1
+
+DEFAULT_MAX_ATTEMPTS = 5
+
+DEFAULT_INITIAL_RETRY_DELAY_SEC = 1
+
+DEFAULT_MAX_RETRY_DELAY_SEC = 30
+
+# Model creation waits for the server to set up the metric's backlog
+DEFAULT_REQUEST_TIMEOUT_SEC = 300
+
+DEFAULT_PROGRESS_INTERVAL_SEC = 30
+
+# HTTP status codes that are retried
+_TRANSIENT_STATUS_CODES = frozenset([500, 502, 503, 504])
+
+
+
+g_log = logging.getLogger("taurus_metric_collectors.model_bootstrap")
+
+
+
+# Result of ModelBootstrapper.run()
+#
+# numCreated: number of models created during this run
+# numSkipped: number of models skipped because the resume file has them
+# failedMetricNames: sorted names of metrics whose models could not be created
+BootstrapResult = namedtuple("BootstrapResult",
+                             "numCreated numSkipped failedMetricNames")
+
+
+
+class _TransientRequestError(Exception):
+  """ A model creation request failed in a way that may succeed on retry """
+  pass
+
+
+
+def loadResumeFile(path):
+  """ Load the names of metrics whose models were created by earlier runs
+
+  :param path: path of the resume file; a missing file is the same as an empty
+    one
+  :returns: metric names
+  :rtype: set
+  """
+  metricNames = set()
+
+  if not os.path.exists(path):
+    return metricNames
+
+  with open(path) as fileObj:
+    for line in fileObj:
+      try:
+        metricNames.add(json.loads(line)["metric"])
+      except (ValueError, KeyError, TypeError):
+        # The last line may have been truncated by a crash mid-write
+        g_log.warning("Ignoring malformed resume file line=%r", line)
+
+  return metricNames
+
+
+
+class ModelBootstrapper(object):
+  """ Creates models from model specs with bounded concurrency """
+
+  def __init__(self,
+               baseUrl,
+               apiKey,
+               concurrency=DEFAULT_CONCURRENCY,
+               bulkSize=DEFAULT_BULK_SIZE,
+               resumePath=None,
+               maxAttempts=DEFAULT_MAX_ATTEMPTS,
+               initialRetryDelaySec=DEFAULT_INITIAL_RETRY_DELAY_SEC,
+               maxRetryDelaySec=DEFAULT_MAX_RETRY_DELAY_SEC,
+               requestTimeoutSec=DEFAULT_REQUEST_TIMEOUT_SEC,
+               progressIntervalSec=DEFAULT_PROGRESS_INTERVAL_SEC,
+               verify=False):
+    """
+    :param baseUrl: base URL of the Taurus API; e.g., "https://host"
+    :param apiKey: API server's API Key
+    :param concurrency: max number of model creation requests in flight
+    :param bulkSize: number of model specs per request; 1 for a request per
+      model
+    :param resumePath: path of the resume file; None to not record created
+      models
+    :param maxAttempts: max attempts of a request that fails transiently
+    :param initialRetryDelaySec: delay before the first retry; doubled on each
+      subsequent retry
+    :param maxRetryDelaySec: cap on the delay between retries
+    :param requestTimeoutSec: HTTP request timeout
+    :param progressIntervalSec: min seconds between progress log messages
+    :param verify: passed to requests to control certificate verification
+    """
+    if concurrency < 1:
+      raise ValueError("concurrency must be positive, but got %r" %
+                       (concurrency,))
+    if bulkSize < 1:
+      raise ValueError("bulkSize must be positive, but got %r" % (bulkSize,))
+    if maxAttempts < 1:
+      raise ValueError("maxAttempts must be positive, but got %r" %
+                       (maxAttempts,))
+
+    self._url = baseUrl.rstrip("/") + "/_models"
+    self._apiKey = apiKey
+    self._concurrency = concurrency
+    self._bulkSize = bulkSize
+    self._resumePath = resumePath
+    self._maxAttempts = maxAttempts
+    self._initialRetryDelaySec = initialRetryDelaySec
+    self._maxRetryDelaySec = maxRetryDelaySec
+    self._requestTimeoutSec = requestTimeoutSec
+    self._progressIntervalSec = progressIntervalSec
+    self._verify = verify
+
+    # Guards the state below, which is shared by the worker threads
+    self._lock = threading.Lock()
+    self._resumeFile = None
+    self._numCreated = 0
+    self._numPending = 0
+    self._failedMetricNames = set()
+    self._quotaError = None
+    self._abortEvent = threading.Event()
+    self._startTime = None
+    self._lastProgressTime = None
+
+
+  def run(self, modelSpecs):
+    """ Create models from the given model specs, skipping metrics recorded in
+    the resume file
+
+    :param modelSpecs: model specs per _models POST API; e.g., from
+      `metric_utils.getCustomModelSpecs()`
+    :returns: BootstrapResult
+
+    :raises: ModelQuotaExceededError if quota limit was exceeded; models created
+      before that are in the resume file
+    """
+    alreadyCreated = (loadResumeFile(self._resumePath)
+                      if self._resumePath is not None else set())
+
+    pendingSpecs = [spec for spec in modelSpecs
+                    if spec["metricSpec"]["metric"] not in alreadyCreated]
+    numSkipped = len(modelSpecs) - len(pendingSpecs)
+
+    g_log.info("Creating %d models (%d skipped per resume file); "
+               "concurrency=%d; bulkSize=%d", len(pendingSpecs), numSkipped,
+               self._concurrency, self._bulkSize)
+
+    self._numCreated = 0
+    self._numPending = len(pendingSpecs)
+    self._failedMetricNames = set()
+    self._quotaError = None
+    self._abortEvent.clear()
+    self._startTime = self._lastProgressTime = time.time()
+
+    if self._resumePath is not None:
+      self._resumeFile = open(self._resumePath, "a+")
+      # Terminate a line truncated by a crash so that the next record doesn't
+      # get appended to it
+      self._resumeFile.seek(0, os.SEEK_END)
+      if self._resumeFile.tell() > 0:
+        self._resumeFile.seek(-1, os.SEEK_END)
+        if self._resumeFile.read(1) != "\n":
+          self._resumeFile.write("\n")
+
+    try:
+      self._runWorkers(pendingSpecs)
+    finally:
+      if self._resumeFile is not None:
+        self._resumeFile.close()
+        self._resumeFile = None
+
+    if self._quotaError is not None:
+      g_log.error("Model quota exceeded after creating %d models",
+                  self._numCreated)
+      raise self._quotaError
+
+    g_log.info("Created %d models in %.1fs; %d failed", self._numCreated,
+               time.time() - self._startTime, len(self._failedMetricNames))
+
+    return BootstrapResult(numCreated=self._numCreated,
+                           numSkipped=numSkipped,
+                           failedMetricNames=sorted(self._failedMetricNames))
+
+
+  def _runWorkers(self, modelSpecs):
+    """ Feed chunks of model specs to the worker threads through a bounded
+    queue and wait for the workers to finish
+    """
+    chunkQueue = Queue.Queue(maxsize=self._concurrency * 2)
+
+    workers = [threading.Thread(target=self._workerMain,
+                                args=(chunkQueue,),
+                                name="ModelBootstrapWorker-%d" % (i,))
+               for i in xrange(self._concurrency)]
+    for worker in workers:
+      worker.setDaemon(True)
+      worker.start()
+
+    try:
+      for i in xrange(0, len(modelSpecs), self._bulkSize):
+        if self._abortEvent.is_set():
+          break
+        chunkQueue.put(modelSpecs[i:i + self._bulkSize])
+    finally:
+      # Sentinels to stop the workers
+      for _ in workers:
+        chunkQueue.put(None)
+
+    for worker in workers:
+      worker.join()
+
+
+  def _workerMain(self, chunkQueue):
+    session = requests.Session()
+    session.auth = (self._apiKey, "")
+    session.verify = self._verify
+
+    try:
+      while True:
+        chunk = chunkQueue.get()
+        if chunk is None:
+          return
+
+        if self._abortEvent.is_set():
+          continue
+
+        try:
+          self._createChunk(session, chunk)
+        except ModelQuotaExceededError as e:
+          with self._lock:
+            if self._quotaError is None:
+              self._quotaError = e
+          self._abortEvent.set()
+        except Exception:  # pylint: disable=W0703
+          g_log.exception("Unexpected error while creating models")
+          self._recordFailed(spec["metricSpec"]["metric"] for spec in chunk)
+    finally:
+      session.close()
+
+
+  def _createChunk(self, session, chunk):
+    """ Create the models of a chunk of model specs; in one request if the
+    chunk has more than one spec, falling back to a request per model
+
+    :raises: ModelQuotaExceededError if quota limit was exceeded
+    """
+    if len(chunk) > 1:
+      try:
+        models = self._post(session, chunk)
+      except ModelQuotaExceededError:
+        raise
+      except Exception as e:  # pylint: disable=W0703
+        g_log.warning("Bulk creation of %d models failed (%r); falling back "
+                      "to a request per model", len(chunk), e)
+      else:
+        self._recordCreated(models)
+        return
+
+    for spec in chunk:
+      metricName = spec["metricSpec"]["metric"]
+      try:
+        models = self._post(session, spec)
+      except ModelQuotaExceededError:
+        raise
+      except Exception as e:  # pylint: disable=W0703
+        g_log.error("Failed to create model for metric=%s: %r", metricName, e)
+        self._recordFailed([metricName])
+      else:
+        self._recordCreated(models)
+
+
+  def _post(self, session, payload):
+    """ POST the model spec or list of model specs to the _models API,
+    retrying transient failures with exponential backoff
+
+    :returns: model info dicts from the response
+    :rtype: list of dicts
+
+    :raises: ModelQuotaExceededError if quota limit was exceeded
+    :raises: ModelMonitorRequestError if the request was rejected
+    :raises: RetriesExceededError if retries were exceeded
+    """
+    body = json.dumps(payload)
+    delaySec = self._initialRetryDelaySec
+
+    for attempt in xrange(1, self._maxAttempts + 1):
+      try:
+        response = session.post(self._url, data=body,
+                                 timeout=self._requestTimeoutSec)
+
+        if response.status_code == 201:
+          return json.loads(response.text)
+
+        # TODO: this check for "Server limit exceeded" is temporary for MER-1366
+        if (response.status_code == 500 and
+            "Server limit exceeded" in response.text):
+          raise ModelQuotaExceededError()
+
+        if response.status_code in _TRANSIENT_STATUS_CODES:
+          raise _TransientRequestError("%s (%s)" % (response, response.text))
+
+        raise ModelMonitorRequestError("Unable to create model: %s (%s)" % (
+          response, response.text))
+      except (_TransientRequestError,
+              requests.exceptions.ConnectionError,
+              requests.exceptions.Timeout) as e:
+        if attempt == self._maxAttempts or self._abortEvent.is_set():
+          raise RetriesExceededError(
+            "Create-model retries exceeded after %d attempts: %r" % (attempt,
+                                                                     e))
+
+        g_log.warning("Transient error while creating model (attempt %d of "
+                      "%d); retrying in %ss: %r", attempt, self._maxAttempts,
+                      delaySec, e)
+        time.sleep(delaySec)
+        delaySec = min(delaySec * 2, self._maxRetryDelaySec)
+
+
+  def _recordCreated(self, models):
+    with self._lock:
+      for model in models:
+        if self._resumeFile is not None:
+          self._resumeFile.write(
+            json.dumps({"metric": model["name"], "uid": model["uid"]}) + "\n")
+        self._numCreated += 1
+        self._numPending -= 1
+
+      if self._resumeFile is not None:
+        self._resumeFile.flush()
+        os.fsync(self._resumeFile.fileno())
+
+      self._logProgressIfDue()
+
+
+  def _recordFailed(self, metricNames):
+    with self._lock:
+      for metricName in metricNames:
+        self._failedMetricNames.add(metricName)
+        self._numPending -= 1
+
+      self._logProgressIfDue()
+
+
+  def _logProgressIfDue(self):
+    """ NOTE: the caller must hold self._lock """
+    now = time.time()
+    if now - self._lastProgressTime < self._progressIntervalSec:
+      return
+
+    self._lastProgressTime = now
+
+    rate = self._numCreated / max(now - self._startTime, 1e-6)
+    etaSec = self._numPending / rate if rate else float("inf")
+
+    g_log.info("Created %d models (%.1f/sec); %d failed; %d remaining; "
+               "ETA %.0fs", self._numCreated, rate,
+               len(self._failedMetricNames), self._numPending, etaSec)
+
+
+
+def bootstrapAllModels(host, apiKey, onlyMetricNames=None, **kwargs):
+  """ Create models corresponding to all metrics in the metrics configuration
+  concurrently; the concurrent counterpart of `metric_utils.createAllModels()`
+
+  NOTE: Has no effect on metrics that have already been promoted to models.
+
+  :param str host: API server's hostname or IP address
+  :param str apiKey: API server's API Key
+  :param onlyMetricNames: None to create models for all configured metrics; an
+    iterable of metric names to limit creation of models only to metrics with
+    those names - the metric names in the iterable MUST be a non-empty subset of
+    the configured metrics.
+  :type onlyMetricNames: None or iterable
+  :param kwargs: additional args for `ModelBootstrapper`; e.g., concurrency,
+    bulkSize, resumePath
+
+  :returns: BootstrapResult
+
+  :raises: ModelQuotaExceededError if quota limit was exceeded
+  :raises: ValueError if onlyMetricNames is invalid
+  """
+  modelSpecs = metric_utils.getCustomModelSpecs(
+    metric_utils.getMetricsConfiguration(),
+    onlyMetricNames=onlyMetricNames)
+
+  return ModelBootstrapper(baseUrl="https://%s" % (host,),
+                           apiKey=apiKey,
+                           **kwargs).run(modelSpecs)
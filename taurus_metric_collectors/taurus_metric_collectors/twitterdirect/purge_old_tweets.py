@@ -21,7 +21,8 @@
 # ----------------------------------------------------------------------
 
 """
-Purges old records from taurus_collectors.twitter_tweets table.
+Purges old records from taurus_collectors.twitter_tweets table and the
+corresponding tweet volume counts from taurus_collectors.twitter_tweet_volume.
 
 NOTE: this script may be configured as "console" app by the package
 installer.
@@ -51,8 +52,9 @@ def _parseArgs():
   :returns: dict of arg names and values:
     days - Messages older than this number of days will be purged
   """
-  helpString = ("%prog [options] Purges old records from {} table.").format(
-    collectorsdb.schema.twitterTweets)
+  helpString = ("%prog [options] Purges old records from {} and {} tables."
+                ).format(collectorsdb.schema.twitterTweets,
+                         collectorsdb.schema.twitterTweetVolume)
 
   parser = OptionParser(helpString)
 
@@ -154,6 +156,64 @@ def purgeOldTweets(thresholdDays):
 
 
 
+def purgeOldTweetVolumeCounts(thresholdDays):
+  """ Purge tweet volume counts from twitter_tweet_volume table whose
+  aggregation timestamps are older than the given number of days.
+
+  :param int thresholdDays: counts older than this many days will be deleted
+
+  :returns: number of rows that were deleted
+  """
+  twitterTweetVolumeSchema = collectorsdb.schema.twitterTweetVolume
+
+  sqlEngine = collectorsdb.engineFactory()
+
+  # NOTE: the counts are keyed by aggregation timestamp first, so we can delete
+  # them in LIMITed batches directly, without querying candidate rows first.
+  totalDeleted = 0
+  while True:
+    numDeleted = _deleteOldTweetVolumeCounts(sqlEngine=sqlEngine,
+                                             thresholdDays=thresholdDays,
+                                             limit=_MAX_DELETE_BATCH_SIZE)
+    totalDeleted += numDeleted
+
+    if numDeleted < _MAX_DELETE_BATCH_SIZE:
+      break
+
+    g_log.info("Purged %s old tweet volume counts [%s so far]", numDeleted,
+               totalDeleted)
+
+  g_log.info("Purged numRows=%s old tweet volume counts from table=%s",
+             totalDeleted, twitterTweetVolumeSchema)
+
+  return totalDeleted
+
+
+
+@collectorsdb.retryOnTransientErrors
+def _deleteOldTweetVolumeCounts(sqlEngine, thresholdDays, limit):
+  """Delete up to the given number of twitter_tweet_volume rows older than the
+  given number of days
+
+  :param sqlalchemy.engine.Engine sqlEngine:
+  :param int thresholdDays: counts older than this many days will be deleted
+  :param int limit: max number of rows to delete
+
+  :returns: number of rows actually deleted
+  """
+  # NOTE: sqlalchemy core doesn't support LIMIT in delete statements
+  return sqlEngine.execute(
+    sql.text(
+      "DELETE FROM {table} "
+      "WHERE agg_ts < DATE_SUB(UTC_TIMESTAMP(), INTERVAL {days:d} DAY) "
+      "ORDER BY agg_ts LIMIT {limit:d}".format(
+        table=collectorsdb.schema.twitterTweetVolume.name,
+        days=thresholdDays,
+        limit=limit))
+  ).rowcount
+
+
+
 @collectorsdb.retryOnTransientErrors
 def _estimateNumTweetsToDelete(sqlEngine, selectionPredicate):
   """
@@ -228,6 +288,7 @@ def main():
       raise
 
     purgeOldTweets(options["days"])
+    purgeOldTweetVolumeCounts(options["days"])
   except Exception:
     g_log.exception("Failed!")
     raise
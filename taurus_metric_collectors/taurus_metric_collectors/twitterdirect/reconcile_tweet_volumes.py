@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Verifies the tweet volume counts in the twitter_tweet_volume table against the
+raw twitter_tweet_samples rows, and optionally fixes the mismatched counts.
+
+The twitter agent maintains the counts as it stores tweets, so they don't
+reflect tweets deleted later at Twitter's request (see
+process_tweet_deletions); such mismatches are expected.
+
+NOTE: this script may be configured as "console" app by the package
+installer.
+"""
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+import logging
+from optparse import OptionParser
+
+import sqlalchemy as sql
+
+from taurus_metric_collectors import collectorsdb, logging_support
+from taurus_metric_collectors.collectorsdb import schema
+
+
+
+g_log = logging.getLogger("reconcile_tweet_volumes")
+
+
+
+# Number of days of aggregation intervals to verify per query
+_DAYS_PER_QUERY = 1
+
+# By default, the most recent aggregation intervals are left out, since tweets
+# are still being stored in them
+_DEFAULT_SETTLING_HOURS = 1
+
+
+# Sets the counts of tweets in the twitter_tweet_volume table
+#
+# NOTE: sqlalchemy doesn't support "ON DUPLICATE KEY UPDATE" in its syntactic
+# sugar; see https://bitbucket.org/zzzeek/sqlalchemy/issue/960
+_SET_TWEET_VOLUME_SQL = sql.text(
+  "INSERT INTO {table} (agg_ts, metric, num_tweets) "
+  "VALUES (:agg_ts, :metric, :num_tweets) "
+  "ON DUPLICATE KEY UPDATE num_tweets = VALUES(num_tweets)"
+  .format(table=schema.twitterTweetVolume.name))
+
+
+
+# A tweet volume count that disagrees with the raw tweet samples
+#
+# aggTs: aggregation timestamp
+# metric: metric name
+# numSamples: number of twitter_tweet_samples rows
+# numCounted: count in twitter_tweet_volume; 0 if absent
+TweetVolumeMismatch = namedtuple("TweetVolumeMismatch",
+                                 "aggTs metric numSamples numCounted")
+
+
+
+def _parseArgs():
+  """
+  :returns: dict of arg names and values:
+    days - number of days of aggregation intervals to verify
+    fix - whether to fix mismatched counts
+  """
+  helpString = (
+    "%prog [options]\n\n"
+    "Verifies the tweet volume counts in the {} table against the {} table."
+    ).format(schema.twitterTweetVolume, schema.twitterTweetSamples)
+
+  parser = OptionParser(helpString)
+
+  parser.add_option(
+    "--days",
+    action="store",
+    type="int",
+    dest="days",
+    default=7,
+    help="Verify aggregation intervals from this many days ago through "
+         "{:d} hour(s) ago [default: %default]".format(_DEFAULT_SETTLING_HOURS))
+
+  parser.add_option(
+    "--fix",
+    action="store_true",
+    dest="fix",
+    default=False,
+    help="Set mismatched counts to the number of raw tweet samples")
+
+  options, remainingArgs = parser.parse_args()
+  if remainingArgs:
+    parser.error("Unexpected remaining args: {}".format(remainingArgs))
+
+  if options.days <= 0:
+    parser.error("--days must be positive")
+
+  return dict(
+    days=options.days,
+    fix=options.fix)
+
+
+
+def reconcileTweetVolumes(startDatetime, stopDatetime, fix=False):
+  """ Compare the tweet volume counts of the aggregation intervals in the given
+  range against the raw tweet samples.
+
+  :param datetime startDatetime: UTC datetime of first aggregation interval to
+    verify
+  :param datetime stopDatetime: non-inclusive upper bound UTC datetime of
+    aggregation intervals to verify
+  :param bool fix: if True, set the mismatched counts to the number of raw
+    tweet samples
+
+  :returns: the mismatches found
+  :rtype: list of TweetVolumeMismatch
+  """
+  sqlEngine = collectorsdb.engineFactory()
+
+  allMismatches = []
+
+  chunkStartDatetime = startDatetime
+  while chunkStartDatetime < stopDatetime:
+    chunkStopDatetime = min(chunkStartDatetime + timedelta(days=_DAYS_PER_QUERY),
+                            stopDatetime)
+
+    mismatches = _findMismatches(sqlEngine, chunkStartDatetime,
+                                 chunkStopDatetime)
+
+    g_log.info("Found numMismatches=%d in agg range [%s, %s)",
+               len(mismatches), chunkStartDatetime, chunkStopDatetime)
+
+    for mismatch in mismatches:
+      g_log.info("Mismatch: %r", mismatch)
+
+    if fix and mismatches:
+      _setTweetVolumeCounts(sqlEngine, mismatches)
+      g_log.info("Fixed numCounts=%d", len(mismatches))
+
+    allMismatches.extend(mismatches)
+    chunkStartDatetime = chunkStopDatetime
+
+  return allMismatches
+
+
+
+@collectorsdb.retryOnTransientErrors
+def _findMismatches(sqlEngine, startDatetime, stopDatetime):
+  """ Compare counts with raw tweet samples within one transaction, so that
+  both are read from the same snapshot
+
+  :returns: sequence of TweetVolumeMismatch ordered by aggTs and metric
+  """
+  samplesSchema = schema.twitterTweetSamples
+  volumeSchema = schema.twitterTweetVolume
+
+  with sqlEngine.begin() as conn:
+    numSamples = dict(
+      ((aggTs, metric), count)
+      for aggTs, metric, count in conn.execute(
+        sql.select([samplesSchema.c.agg_ts,
+                    samplesSchema.c.metric,
+                    sql.func.count()])
+        .where((samplesSchema.c.agg_ts >= startDatetime) &
+               (samplesSchema.c.agg_ts < stopDatetime))
+        .group_by(samplesSchema.c.agg_ts, samplesSchema.c.metric)))
+
+    numCounted = dict(
+      ((aggTs, metric), count)
+      for aggTs, metric, count in conn.execute(
+        sql.select([volumeSchema.c.agg_ts,
+                    volumeSchema.c.metric,
+                    volumeSchema.c.num_tweets])
+        .where((volumeSchema.c.agg_ts >= startDatetime) &
+               (volumeSchema.c.agg_ts < stopDatetime))))
+
+  return [
+    TweetVolumeMismatch(aggTs=aggTs,
+                        metric=metric,
+                        numSamples=numSamples.get((aggTs, metric), 0),
+                        numCounted=numCounted.get((aggTs, metric), 0))
+    for aggTs, metric in sorted(set(numSamples) | set(numCounted))
+    if numSamples.get((aggTs, metric), 0) != numCounted.get((aggTs, metric), 0)
+  ]
+
+
+
+@collectorsdb.retryOnTransientErrors
+def _setTweetVolumeCounts(sqlEngine, mismatches):
+  """ Set the given counts to their number of raw tweet samples
+
+  :param sequence mismatches: TweetVolumeMismatch objects
+  """
+  sqlEngine.execute(
+    _SET_TWEET_VOLUME_SQL,
+    [dict(agg_ts=mismatch.aggTs,
+          metric=mismatch.metric,
+          num_tweets=mismatch.numSamples)
+     for mismatch in mismatches])
+
+
+
+def main():
+  """
+  NOTE: main also serves as entry point for "console script" generated by setup
+  """
+  logging_support.LoggingSupport().initTool()
+
+  try:
+    try:
+      options = _parseArgs()
+    except SystemExit as e:
+      # OptionParser uses SystemExit on option-parsing error
+      if e.code != 0:
+        g_log.exception("Failed!")
+      raise
+
+    stopDatetime = (datetime.utcnow().replace(minute=0, second=0,
+                                              microsecond=0) -
+                    timedelta(hours=_DEFAULT_SETTLING_HOURS))
+
+    mismatches = reconcileTweetVolumes(
+      startDatetime=stopDatetime - timedelta(days=options["days"]),
+      stopDatetime=stopDatetime,
+      fix=options["fix"])
+
+    g_log.info("%s numMismatches=%d", "Fixed" if options["fix"] else "Found",
+               len(mismatches))
+  except Exception:
+    g_log.exception("Failed!")
+    raise
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,365 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Tweet tagging engine of the twitter agent: matches Twitter statuses against
+the symbols and user ids of the twitter metrics, and optionally decodes and
+tags raw streamed messages in worker processes that feed the tweet storer.
+"""
+
+from collections import deque
+import json
+import logging
+import multiprocessing
+import Queue
+import re
+
+from nta.utils.error_handling import logExceptions
+
+
+
+g_log = logging.getLogger(__name__)
+
+
+
+class TweetTagger(object):
+  """ Tags Twitter statuses with the names of the metrics that they match.
+
+  The lookup tables are built once, so that tagging a status takes a single
+  pass over its user, symbol and mention entities and, if requested, over its
+  text. TweetTagger instances are picklable, so that they may be sent to
+  tagging worker processes.
+  """
+
+  # Matches cashtags and mentions in lowercased tweet text; e.g., "$brk.b" and
+  # "@accenture". The optional ".<suffix>" accomodates class share symbols.
+  _TEXT_TOKEN_REGEX = re.compile(r"(?<![\w$@])[$@][a-z0-9_]+(?:\.[a-z0-9_]+)?",
+                                 re.UNICODE)
+
+
+  def __init__(self, symbolToMetricMap, userIdToMetricsMap,
+               screenNameToMetricsMap, tagText=False):
+    """
+    :param dict symbolToMetricMap: lowercase stock symbol to metric name map
+    :param dict userIdToMetricsMap: twitter user id string to a set of metric
+      names
+    :param dict screenNameToMetricsMap: lowercase twitter screen name to a set
+      of metric names; used for tagging text
+    :param bool tagText: if True, also tag on cashtags and mentions in the
+      status text, including those missing from the status entities
+    """
+    self._symbolToMetrics = dict(
+      (symbol, frozenset([metric]))
+      for symbol, metric in symbolToMetricMap.iteritems())
+
+    self._userIdToMetrics = dict(
+      (userId, frozenset(metrics))
+      for userId, metrics in userIdToMetricsMap.iteritems())
+
+    self._textTokenToMetrics = None
+    if tagText:
+      self._textTokenToMetrics = dict(
+        ("$" + symbol, metrics)
+        for symbol, metrics in self._symbolToMetrics.iteritems())
+      self._textTokenToMetrics.update(
+        ("@" + screenName, frozenset(metrics))
+        for screenName, metrics in screenNameToMetricsMap.iteritems())
+
+
+  def tag(self, msg):
+    """ Tag message: add "metricTagSet" attribute to the message; the value
+    of "metricTagSet" is a possibly-empty set containing metric name(s) that
+    match the containing message.
+
+    :param dict msg: Twitter status object
+
+    :returns: the message's metricTagSet
+    :rtype: set
+    """
+    tags = set()
+
+    userObj = msg.get("user")
+    if userObj:
+      metrics = self._userIdToMetrics.get(userObj.get("id_str"))
+      if metrics:
+        tags.update(metrics)
+
+    entities = msg.get("entities")
+    if entities:
+      symbolToMetrics = self._symbolToMetrics
+      for sym in entities.get("symbols") or ():
+        ticker = sym.get("text")
+        if ticker:
+          metrics = symbolToMetrics.get(ticker.lower())
+          if metrics:
+            tags.update(metrics)
+
+      userIdToMetrics = self._userIdToMetrics
+      for mention in entities.get("user_mentions") or ():
+        metrics = userIdToMetrics.get(mention.get("id_str"))
+        if metrics:
+          tags.update(metrics)
+
+    if self._textTokenToMetrics is not None:
+      self._tagText(msg, tags)
+
+    msg["metricTagSet"] = tags
+    return tags
+
+
+  def _tagText(self, msg, tags):
+    """ Add names of metrics matching cashtags and mentions in the status text
+    to the given tag set
+    """
+    extendedTweet = msg.get("extended_tweet")
+    text = ((extendedTweet and extendedTweet.get("full_text")) or
+            msg.get("text"))
+    if not text or ("$" not in text and "@" not in text):
+      return
+
+    tokenToMetrics = self._textTokenToMetrics
+    for token in self._TEXT_TOKEN_REGEX.findall(text.lower()):
+      metrics = tokenToMetrics.get(token)
+      if metrics is None and "." in token:
+        # E.g., trailing punctuation in "$goog.and then"
+        metrics = tokenToMetrics.get(token.split(".", 1)[0])
+      if metrics:
+        tags.update(metrics)
+
+
+
+def decodeAndTagMessages(tagger, messages):
+  """ Decode raw streamed messages and tag the tweets among them. Tweets that
+  don't match any metrics are reduced to the attributes used for stream
+  accounting, so that they are cheap to hand over to the tweet storer.
+
+  :param TweetTagger tagger:
+  :param messages: raw JSON strings received from the Twitter stream
+  :returns: list of decoded messages corresponding to `messages`; tweets carry
+    a "metricTagSet" attribute; messages that fail to decode are returned
+    as is.
+  """
+  results = []
+  for data in messages:
+    try:
+      msg = json.loads(data)
+    except ValueError:
+      # Leave reporting of the incomplete message to the tweet storer
+      results.append(data)
+      continue
+
+    if isinstance(msg, dict) and "in_reply_to_status_id" in msg:
+      if not tagger.tag(msg):
+        msg = {"in_reply_to_status_id": msg["in_reply_to_status_id"],
+               "metricTagSet": msg["metricTagSet"]}
+
+    results.append(msg)
+
+  return results
+
+
+
+@logExceptions(g_log)
+def _runTaggingWorker(requestQ, resultQ):
+  """ Tagging worker process target: decodes and tags batches of raw messages
+  from requestQ using the most recently received TweetTagger and places the
+  results on resultQ.
+
+  :param multiprocessing.Queue requestQ: receives TweetTagger instances and
+    (seq, messages) pairs
+  :param multiprocessing.Queue resultQ: receives the (seq, decodedMessages)
+    pairs
+  """
+  tagger = None
+  try:
+    while True:
+      request = requestQ.get()
+      if isinstance(request, TweetTagger):
+        tagger = request
+        continue
+
+      seq, messages = request
+      resultQ.put((seq, decodeAndTagMessages(tagger, messages)))
+  except KeyboardInterrupt:
+    # Normal exit in response to SIGINT
+    g_log.info("KeyboardInterrupt detected, exiting tagging worker")
+
+
+
+class TweetTaggingPool(object):
+  """ Worker processes that decode and tag the raw messages of one Twitter
+  stream on behalf of the stream's TweetStorer.
+
+  The pool is started before the stream worker process is forked, because
+  pool worker processes may not start processes of their own. The stream
+  worker process then:
+    1. sends its TweetTagger via `setTagger()`;
+    2. feeds raw messages from the stream listener via `runFeeder()` in a
+       thread;
+    3. hands the pool to TweetStorer as its message queue: `get()` returns
+       the decoded and tagged messages in the order they were received.
+
+  Messages other than strings, such as connection markers, aren't sent to
+  the workers, but they are still returned in order.
+  """
+
+  # Maximum number of raw messages per batch sent to a worker
+  _MAX_BATCH_SIZE = 100
+
+  # Maximum duration to accumulate a partial batch, in seconds
+  _MAX_BATCH_DELAY_SEC = 0.1
+
+
+  def __init__(self, numWorkers):
+    """
+    :param int numWorkers: number of tagging worker processes
+    """
+    self._requestQueues = [multiprocessing.Queue() for _ in xrange(numWorkers)]
+    self._resultQ = multiprocessing.Queue()
+
+    self._workers = [
+      multiprocessing.Process(target=_runTaggingWorker,
+                              args=(requestQ, self._resultQ),
+                              name="TweetTaggingWorker-%d" % (i,))
+      for i, requestQ in enumerate(self._requestQueues)
+    ]
+    for worker in self._workers:
+      worker.daemon = True
+
+    # Sequence number of the next batch to submit
+    self._nextSubmitSeq = 0
+
+    # Sequence number of the next batch to return from `get()`
+    self._nextResultSeq = 0
+
+    # Out-of-order results by sequence number
+    self._pendingResults = dict()
+
+    # Messages that aren't sent to the workers, by sequence number
+    self._passThroughMessages = dict()
+
+    # Messages of the current batch not yet returned from `get()`
+    self._readyMessages = deque()
+
+
+  def start(self):
+    """ Start the worker processes """
+    for worker in self._workers:
+      worker.start()
+
+    g_log.info("Started numTaggingWorkers=%d", len(self._workers))
+
+
+  def terminate(self):
+    """ Terminate the worker processes """
+    for worker in self._workers:
+      if worker.is_alive():
+        worker.terminate()
+
+
+  def isAlive(self):
+    """ :returns: True if all worker processes are running """
+    return all(worker.is_alive() for worker in self._workers)
+
+
+  def setTagger(self, tagger):
+    """ Tag the messages of subsequent batches with the given tagger
+
+    :param TweetTagger tagger:
+    """
+    for requestQ in self._requestQueues:
+      requestQ.put(tagger)
+
+
+  def submit(self, messages):
+    """ Submit messages for decoding and tagging. Not thread-safe; there must
+    be only one submitting thread.
+
+    :param messages: sequence of raw JSON strings and other messages to pass
+      through
+    """
+    batch = []
+    for msg in messages:
+      if isinstance(msg, basestring):
+        batch.append(msg)
+        continue
+
+      if batch:
+        self._submitBatch(batch)
+        batch = []
+
+      # Pass through in order
+      seq = self._nextSubmitSeq
+      self._nextSubmitSeq += 1
+      self._passThroughMessages[seq] = msg
+      self._resultQ.put((seq, None))
+
+    if batch:
+      self._submitBatch(batch)
+
+
+  def _submitBatch(self, batch):
+    seq = self._nextSubmitSeq
+    self._nextSubmitSeq += 1
+    self._requestQueues[seq % len(self._requestQueues)].put((seq, batch))
+
+
+  def runFeeder(self, msgQ):
+    """ Feed messages from the given queue to the workers in batches; runs
+    forever, normally in a thread of its own.
+
+    :param Queue.Queue msgQ: queue of messages from the stream listener
+    """
+    while True:
+      messages = [msgQ.get()]
+      while len(messages) < self._MAX_BATCH_SIZE:
+        try:
+          messages.append(msgQ.get(timeout=self._MAX_BATCH_DELAY_SEC))
+        except Queue.Empty:
+          break
+
+      self.submit(messages)
+
+
+  def get(self, timeout=None):
+    """ Get the next decoded message in the order of submission; compatible
+    with `Queue.Queue.get()`, so that the pool may serve as TweetStorer's
+    message queue. Not thread-safe; there must be only one getting thread.
+
+    :param timeout: if None, block until a message is available; otherwise, the
+      maximum number of seconds to wait
+    :returns: the next decoded message; see `decodeAndTagMessages()`
+    :raises Queue.Empty: if timeout expired before a message was available
+    """
+    while not self._readyMessages:
+      seq = self._nextResultSeq
+      if seq in self._pendingResults:
+        messages = self._pendingResults.pop(seq)
+        if messages is None:
+          messages = [self._passThroughMessages.pop(seq)]
+        self._readyMessages.extend(messages)
+        self._nextResultSeq += 1
+        continue
+
+      resultSeq, messages = self._resultQ.get(timeout=timeout)
+      self._pendingResults[resultSeq] = messages
+
+    return self._readyMessages.popleft()
@@ -26,6 +26,7 @@ from datetime import datetime, timedelta
 from itertools import islice
 import json
 import logging
+import math
 import multiprocessing
 from optparse import OptionParser
 import os
@@ -52,6 +53,7 @@ from taurus_metric_collectors import metric_utils
 from taurus_metric_collectors.metric_utils import getMetricsConfiguration
 from taurus_metric_collectors.text_utils import sanitize4ByteUnicode
 from taurus_metric_collectors.twitterdirect import purge_old_tweets
+from taurus_metric_collectors.twitterdirect import tweet_tagging
 
 
 
@@ -73,6 +75,17 @@ DEFAULT_ACCESS_TOKEN_SECRET = os.environ.get(
 _EMITTED_TWEET_VOLUME_SAMPLE_TRACKER_KEY = "twitter-tweets-volume"
 
 
+# Adds to the counts of tweets in the twitter_tweet_volume table
+#
+# NOTE: sqlalchemy doesn't support "ON DUPLICATE KEY UPDATE" in its syntactic
+# sugar; see https://bitbucket.org/zzzeek/sqlalchemy/issue/960
+_INCREMENT_TWEET_VOLUME_SQL = sql.text(
+  "INSERT INTO {table} (agg_ts, metric, num_tweets) "
+  "VALUES (:agg_ts, :metric, :num_tweets) "
+  "ON DUPLICATE KEY UPDATE num_tweets = num_tweets + VALUES(num_tweets)"
+  .format(table=schema.twitterTweetVolume.name))
+
+
 # Initialize logging
 g_log = logging.getLogger("twitter_direct_agent")
 
@@ -109,42 +122,33 @@ def loadMetricSpecs():
 
 
 
-def buildTaggingMapAndStreamFilterParams(metricSpecs, authHandler):
-  """ Build tweet tag processing map and the corresponding twitter stream filter
-  params
+def buildTweetTaggerAndStreamFilterParams(metricSpecs, authHandler,
+                                          tagText=False):
+  """ Build tweet tagger and the corresponding twitter stream filter params
 
   :param metricSpecs: sequence of TwitterMetricSpec objects
-
-  :returns: a two-tuple (<taggingMap>, <streamFilterParams>)
-    <taggingMap>: a dict of callables to corresponding mapping dictionaries;
-      each mapping dictionary key is a target value of interest (e.g., stock
-      ticker) and the corresponding value is the name(s) of the metric(s)
-      corresonding to that value; the callable is passed each message and
-      the mapping dictionary corresponding to the callable, and is responsible
-      for adding metric names to the metricTagSet of the message for any hits
-      that it finds. This example demonstrates the structure of the
-      <taggingMap>:
-        {
-          tagOnSymbols: {
-            "ACN": "TWITTER.TWEET.HANDLE.ACN.VOLUME",
-            "IRBT": "TWITTER.TWEET.HANDLE.IRBT.VOLUME",
+  :param bool tagText: whether the tagger should also tag on cashtags and
+    mentions in tweet text; see `tweet_tagging.TweetTagger`
+
+  :returns: a two-tuple (<tagger>, <streamFilterParams>)
+    <tagger>: a tweet_tagging.TweetTagger instance that tags tweets with the
+      names of the metrics whose symbol is among the tweet's cashtags, or one
+      of whose screen names is the tweet's source user or is among the tweet's
+      mentions. It's built from the following maps:
+        symbolToMetricMap:
+          {
+            "acn": "TWITTER.TWEET.HANDLE.ACN.VOLUME",
+            "irbt": "TWITTER.TWEET.HANDLE.IRBT.VOLUME",
             . . .
-          },
-          tagOnSourceUsers: {
-            "10194682": set(["TWITTER.TWEET.HANDLE.ACN.VOLUME"]),  # @Accenture
-            "20536157": set(["TWITTER.TWEET.HANDLE.GOOGL.VOLUME",
-                             "TWITTER.TWEET.HANDLE.GOOG.VOLUME"]), # @google
-            "111682122": set(["TWITTER.TWEET.HANDLE.IRBT.VOLUME"]) # @RoombaLove
-            . . .
-          },
-          tagOnMentions: {
+          }
+        userIdToMetricsMap:
+          {
             "10194682": set(["TWITTER.TWEET.HANDLE.ACN.VOLUME"]),  # @Accenture
             "20536157": set(["TWITTER.TWEET.HANDLE.GOOGL.VOLUME",
                              "TWITTER.TWEET.HANDLE.GOOG.VOLUME"]), # @google
             "111682122": set(["TWITTER.TWEET.HANDLE.IRBT.VOLUME"]) # @RoombaLove
             . . .
           }
-        }
     <streamFilterParams>: a dictionary of parameters to pass to
       tweepy.Stream.filter(); for examle:
         {
@@ -152,70 +156,11 @@ def buildTaggingMapAndStreamFilterParams(metricSpecs, authHandler):
           "follow": ["10194682", "62515374", "111682122",]
         }
   """
-  g_log.info("Building Metric Tagging Map and Stream Filter Params")
-
-  def tagOnSymbols(msg, mappings):
-    """ Adds metric names to msg["metricTagSet"] for each cashtag in msg with a
-    matching key in mappings
-    """
-    entities = msg.get("entities")
-    if not entities:
-      return
-    symbols = entities.get("symbols")
-    if not symbols:
-      return
-
-    for sym in symbols:
-      ticker = sym.get("text")
-      if not ticker:
-        continue
-      metricName = mappings.get(ticker.lower())
-      if metricName:
-        msg["metricTagSet"].add(metricName)
-
-  def tagOnSourceUsers(msg, mappings):
-    """ Adds metric name(s) to msg["metricTagSet"] corresponding to the matching
-    source twitter user id in mappings, if any
-
-    :param mappings: userId-to-metricNames map
-    """
-    userObj = msg.get("user")
-    if not userObj:
-      return
-    idStr = userObj.get("id_str")
-    metricNames = mappings.get(idStr)
-    if metricNames:
-      msg["metricTagSet"].update(metricNames)
-
-  def tagOnMentions(msg, mappings):
-    """ Adds metric names to msg["metricTagSet"] corresponding to the matching
-    twitter mention user ids in mappings, if any
-
-    :param mappings: userId-to-metricNames map
-    """
-    entities = msg.get("entities")
-    if not entities:
-      return
-    userMentions = entities.get("user_mentions")
-    if not userMentions:
-      return
-
-    for mention in userMentions:
-      idStr = mention.get("id_str")
-      metricNames = mappings.get(idStr)
-      if metricNames:
-        msg["metricTagSet"].update(metricNames)
-
+  g_log.info("Building Tweet Tagger and Stream Filter Params")
 
   symbolToMetricMap = dict()
   userIdToMetricsMap = dict()
 
-  taggingMap = {
-    tagOnSymbols: symbolToMetricMap,
-    tagOnSourceUsers: userIdToMetricsMap,
-    tagOnMentions: userIdToMetricsMap
-  }
-
   screenNameToMetricsMap = dict()
 
   tweepyApi = tweepy.API(authHandler)
@@ -255,6 +200,12 @@ def buildTaggingMapAndStreamFilterParams(metricSpecs, authHandler):
   if unmappedScreenNames:
     g_log.error("No mappings for screenNames=%s", unmappedScreenNames)
 
+  tagger = tweet_tagging.TweetTagger(
+    symbolToMetricMap=symbolToMetricMap,
+    userIdToMetricsMap=userIdToMetricsMap,
+    screenNameToMetricsMap=screenNameToMetricsMap,
+    tagText=tagText)
+
   # Generate stream filter parameters
   streamFilterParams = dict(
     track=([("@" + screen) for screen in screenNameToMetricsMap] +
@@ -263,8 +214,7 @@ def buildTaggingMapAndStreamFilterParams(metricSpecs, authHandler):
     stall_warnings=True
   )
 
-
-  return taggingMap, streamFilterParams
+  return tagger, streamFilterParams
 
 
 
@@ -282,7 +232,8 @@ class TwitterStreamListener(tweepy.StreamListener):
 
 
   def __init__(self, metricSpecs, aggPeriod, consumerKey, consumerSecret,
-               accessToken, accessTokenSecret, echoData):
+               accessToken, accessTokenSecret, echoData, tagText=False,
+               taggingPool=None):
     """
     :param metricSpecs: The metrics for which this Twitter Stream Listener
       instance is responsible.
@@ -293,6 +244,10 @@ class TwitterStreamListener(tweepy.StreamListener):
     :param accessToken: Twitter access token
     :param accessTokenSecret: Twitter access token secret
     :param echoData: Echo processed Twitter messages to stdout for debugging
+    :param tagText: Also tag tweets on cashtags and mentions in their text
+    :param taggingPool: if not None, the started tweet_tagging.TweetTaggingPool
+      that decodes and tags messages on behalf of our tweet storage thread;
+      otherwise, the storage thread decodes and tags messages itself
     """
     super(TwitterStreamListener, self).__init__()
 
@@ -303,6 +258,8 @@ class TwitterStreamListener(tweepy.StreamListener):
     self._accessToken=accessToken
     self._accessTokenSecret=accessTokenSecret
     self._echoData = echoData
+    self._tagText = tagText
+    self._taggingPool = taggingPool
 
     # See OP_MODE_ACTIVE, etc. in ApplicationConfig
     self._opMode = config.get("twitter_direct_agent", "opmode")
@@ -313,6 +270,7 @@ class TwitterStreamListener(tweepy.StreamListener):
                                        self._accessTokenSecret)
 
     self._storageThread = None
+    self._taggingFeederThread = None
     self._messageHoldingQ = Queue.Queue()
     self._streamFilterParams = None
 
@@ -375,22 +333,43 @@ class TwitterStreamListener(tweepy.StreamListener):
                      "has stopped")
       sys.exit(1)
 
+    if (self._taggingFeederThread is not None and
+        not self._taggingFeederThread.isAlive()):
+      g_log.critical("Exiting streaming process, because our tagging feeder "
+                     "thread has stopped")
+      sys.exit(1)
+
 
   def run(self):
     """ Run the Twitter stream listener. """
     g_log.info("%s is running: opMode=%s", self.__class__.__name__,
                self._opMode)
 
-    taggingMap, self._streamFilterParams = (
-      buildTaggingMapAndStreamFilterParams(self._metricSpecs,
-                                           self._authHandler))
+    tagger, self._streamFilterParams = (
+      buildTweetTaggerAndStreamFilterParams(self._metricSpecs,
+                                            self._authHandler,
+                                            tagText=self._tagText))
+
+    storerMsgQ = self._messageHoldingQ
+    if self._taggingPool is not None:
+      # Feed our messages to the tagging workers and let the tweet storage
+      # thread consume the decoded and tagged messages from the pool
+      self._taggingPool.setTagger(tagger)
+
+      self._taggingFeederThread = threading.Thread(
+        target=logExceptions(g_log)(self._taggingPool.runFeeder),
+        kwargs=dict(msgQ=self._messageHoldingQ))
+      self._taggingFeederThread.setDaemon(True)
+      self._taggingFeederThread.start()
+
+      storerMsgQ = self._taggingPool
 
     # Start tweet storage thread
     storageThreadKwargs=dict(
       aggSec=self._aggregationPeriod,
-      msgQ=self._messageHoldingQ,
+      msgQ=storerMsgQ,
       echoData=self._echoData,
-      taggingMap=taggingMap)
+      tagger=tagger)
 
     self._storageThread = threading.Thread(
       target=TweetStorer.runInThread,
@@ -500,16 +479,17 @@ class TweetStorer(object):
         self.streamNumber,)
 
 
-  def __init__(self, taggingMap, aggSec, msgQ, echoData):
+  def __init__(self, tagger, aggSec, msgQ, echoData):
     """
-    :param taggingMap: tweet tagging map as returned by
-      `buildTaggingMapAndStreamFilterParams()`
+    :param tagger: tweet_tagging.TweetTagger as returned by
+      `buildTweetTaggerAndStreamFilterParams()`
     :param int aggSec: metric aggregation period in seconds
     :param Queue.Queue msgQ: input messages queue receiving messages from our
-      TwitterStreamListener
+      TwitterStreamListener, or a tweet_tagging.TweetTaggingPool that decodes
+      and tags them
     :param bool echoData: wheter we should log incoming messages
     """
-    self._taggingMap = taggingMap
+    self._tagger = tagger
     self._aggSec = aggSec
     self._msgQ = msgQ
     self._echoData = echoData
@@ -525,18 +505,19 @@ class TweetStorer(object):
 
   @classmethod
   @logExceptions(g_log)
-  def runInThread(cls, taggingMap, aggSec, msgQ, echoData):
+  def runInThread(cls, tagger, aggSec, msgQ, echoData):
     """ The thread target function; instantiates and runs TweetStorer
 
-    :param taggingMap: tweet tagging map as returned by
-      `buildTaggingMapAndStreamFilterParams()`
+    :param tagger: tweet_tagging.TweetTagger as returned by
+      `buildTweetTaggerAndStreamFilterParams()`
     :param int aggSec: metric aggregation period in seconds
     :param Queue.Queue msgQ: input messages queue receiving messages from our
-      TwitterStreamListener
+      TwitterStreamListener, or a tweet_tagging.TweetTaggingPool that decodes
+      and tags them
     :param bool echoData: wheter we should log incoming messages
     """
     g_log.info("%s thread is running", cls.__name__)
-    tweetStorer = cls(taggingMap=taggingMap,
+    tweetStorer = cls(tagger=tagger,
                       aggSec=aggSec,
                       msgQ=msgQ,
                       echoData=echoData)
@@ -625,8 +606,9 @@ class TweetStorer(object):
     to caller. Other notifications of interest are logged.
 
     :param messages: messages received from our TwitterStreamListener
-    :type messages: sequence of JSON strings representing twitter statuses
-      and/or TwitterStreamListener.ConnectionMarker
+    :type messages: sequence of JSON strings representing twitter statuses,
+      twitter status dicts decoded by TweetTaggingPool, and/or
+      TwitterStreamListener.ConnectionMarker
 
     :returns: a pair (tweets, deletes), where `tweets` is a possibly empty
       sequence of tweet status dicts each matching at least one metric and
@@ -653,13 +635,17 @@ class TweetStorer(object):
           g_log.exception("Decoding failure of twitter message=%r", msg)
           continue
 
+      if isinstance(msg, dict):
+        # Got Twitter Status, decoded above or by TweetTaggingPool
         if "in_reply_to_status_id" in msg:
           # Got a tweet of some sort
           streamStats.numTweets += 1
           runtimeStats.numTweets += 1
 
-          # Tag tweet with metric names that match it, if any
-          self._tagMessage(msg)
+          # Tag tweet with metric names that match it, if any, unless
+          # TweetTaggingPool already did
+          if "metricTagSet" not in msg:
+            self._tagMessage(msg)
 
           if msg["metricTagSet"]:
             # Matched one or more metrics
@@ -735,13 +721,11 @@ class TweetStorer(object):
 
     :param dict msg: Twitter status object
     """
-    msg["metricTagSet"] = set()
-    for tagger, mappings in self._taggingMap.iteritems():
-      try:
-        tagger(msg, mappings)
-      except Exception:
-        g_log.exception("Tagging failed on msg=%s", pprint.pformat(msg))
-        raise
+    try:
+      self._tagger.tag(msg)
+    except Exception:
+      g_log.exception("Tagging failed on msg=%s", pprint.pformat(msg))
+      raise
 
 
   @classmethod
@@ -859,7 +843,8 @@ class TweetStorer(object):
 
 
   def _saveTweets(self, messages, aggRefDatetime):
-    """ Save tweets and references in database
+    """ Save tweets and references in database, and add the references to the
+    tweet volume counts in the same transaction
 
     See https://dev.twitter.com/overview/api/tweets
 
@@ -894,6 +879,10 @@ class TweetStorer(object):
             ).prefix_with("IGNORE", dialect="mysql"),
           tweetRows)
 
+        # Count the new references before saving them, since duplicates are
+        # ignored
+        volumeRows = self._countNewTweetReferences(conn, referenceRows)
+
         # Save corresponding references
         # NOTE: some tweets may match multiple metrics
         conn.execute(
@@ -901,9 +890,50 @@ class TweetStorer(object):
             ).prefix_with("IGNORE", dialect="mysql"),
           referenceRows)
 
+        # Update tweet volume counts
+        if volumeRows:
+          conn.execute(_INCREMENT_TWEET_VOLUME_SQL, volumeRows)
+
     saveWithRetries()
 
 
+  @staticmethod
+  def _countNewTweetReferences(conn, referenceRows):
+    """ Count the given twitter_tweet_samples rows that aren't in the database
+    yet by aggregation timestamp and metric
+
+    :param conn: database connection
+    :param referenceRows: sequence of twitter_tweet_samples row dicts
+    :returns: rows for _INCREMENT_TWEET_VOLUME_SQL, ordered by key to keep lock
+      order consistent among concurrent transactions
+    :rtype: list of dicts
+    """
+    if not referenceRows:
+      return []
+
+    newReferences = dict(((row["metric"], row["msg_uid"]), row["agg_ts"])
+                         for row in referenceRows)
+
+    samplesSchema = schema.twitterTweetSamples
+    existing = conn.execute(
+      sql.select([samplesSchema.c.metric, samplesSchema.c.msg_uid])
+      .where(samplesSchema.c.metric.in_(
+        set(metric for metric, _ in newReferences)))
+      .where(samplesSchema.c.msg_uid.in_(
+        set(msgUid for _, msgUid in newReferences)))
+    ).fetchall()
+
+    for metric, msgUid in existing:
+      newReferences.pop((metric, msgUid), None)
+
+    counts = defaultdict(int)
+    for (metric, _), aggTs in newReferences.iteritems():
+      counts[(aggTs, metric)] += 1
+
+    return [dict(agg_ts=aggTs, metric=metric, num_tweets=count)
+            for (aggTs, metric), count in sorted(counts.iteritems())]
+
+
   def _saveTweetDeletionRequests(self, messages):
     """ Save tweet deletion request in database
 
@@ -1161,6 +1191,14 @@ class TweetForwarder(object):
 class MetricDataForwarder(object):
   """ This class is responsible for aggregating and forwarding metric data """
 
+  # Maximum number of aggregation intervals whose tweet volumes are read by a
+  # single query; after an outage, the emitted sample tracker is
+  # advanced once per chunk of this many intervals
+  _MAX_INTERVALS_PER_CHUNK = 288
+
+  # Number of metric data samples per published batch
+  _PUBLISH_BATCH_SIZE = 2000
+
   def __init__(self, metricSpecs, aggSec):
     self._metricSpecs = metricSpecs
     self._aggSec = aggSec
@@ -1221,6 +1259,9 @@ class MetricDataForwarder(object):
     """ Aggregate tweet volume metrics in the given datetime range and forward
     them to Taurus Engine.
 
+    Tweet volumes are read from the twitter_tweet_volume counters with one
+    query per chunk of up to _MAX_INTERVALS_PER_CHUNK aggregation intervals.
+
     NOTE: this may be called by tooling
 
     NOTE: does not updateLastEmittedSampleDatetime
@@ -1232,44 +1273,58 @@ class MetricDataForwarder(object):
     :param metrics: optional sequence of metric names; if specified (non-None),
       the operation will be limited to the given metric names
     """
-    def getSamples(aggStartDatetime):
-      """Retrieve and yield metric data samples of interest"""
-      periodTimedelta = timedelta(seconds=self._aggSec)
-
-      while aggStartDatetime < stopDatetime:
-        # Query Tweet Volume metrics for one aggregation interval
-        metricToVolumeMap = defaultdict(
-          int,
-          self._queryTweetVolumes(aggStartDatetime, metrics))
-
-        # Generate metric samples
-        epochTimestamp = date_time_utils.epochFromNaiveUTCDatetime(
-          aggStartDatetime)
-
-        samples = tuple(
-          dict(
-            metricName=spec.metric,
-            value=metricToVolumeMap[spec.metric],
-            epochTimestamp=epochTimestamp)
-          for spec in self._metricSpecs
-          if metrics is None or spec.metric in metrics
-        )
-
-        if g_log.isEnabledFor(logging.DEBUG):
-          g_log.debug("samples=%s", pprint.pformat(samples))
+    periodTimedelta = timedelta(seconds=self._aggSec)
+    chunkTimedelta = periodTimedelta * self._MAX_INTERVALS_PER_CHUNK
 
-        for sample in samples:
-          yield sample
+    specs = tuple(spec for spec in self._metricSpecs
+                  if metrics is None or spec.metric in metrics)
 
-        g_log.info("Yielded numSamples=%d for agg=%s",
-                   len(samples), aggStartDatetime)
+    def getSamples(chunkStartDatetime):
+      """Retrieve and yield metric data samples of interest"""
+      while chunkStartDatetime < stopDatetime:
+        chunkStopDatetime = min(chunkStartDatetime + chunkTimedelta,
+                                stopDatetime)
+
+        # Query Tweet Volume metrics for the chunk's aggregation intervals
+        volumes = self._queryTweetVolumesInRange(chunkStartDatetime,
+                                                 chunkStopDatetime,
+                                                 metrics)
+
+        # Generate metric samples, including those of metrics without tweets
+        numSamples = 0
+        aggDatetime = chunkStartDatetime
+        while aggDatetime < chunkStopDatetime:
+          epochTimestamp = date_time_utils.epochFromNaiveUTCDatetime(
+            aggDatetime)
+
+          samples = tuple(
+            dict(
+              metricName=spec.metric,
+              value=volumes.get((aggDatetime, spec.metric), 0),
+              epochTimestamp=epochTimestamp)
+            for spec in specs
+          )
+
+          if g_log.isEnabledFor(logging.DEBUG):
+            g_log.debug("samples=%s", pprint.pformat(samples))
+
+          for sample in samples:
+            yield sample
+
+          numSamples += len(samples)
+          aggDatetime += periodTimedelta
+
+        g_log.info("Yielded numSamples=%d for agg=%s through %s",
+                   numSamples, chunkStartDatetime,
+                   aggDatetime - periodTimedelta)
 
         # Set up for next iteration
-        aggStartDatetime += periodTimedelta
+        chunkStartDatetime = chunkStopDatetime
 
 
     # Emit samples to Taurus Engine
-    with metric_utils.metricDataBatchWrite(log=g_log) as putSample:
+    with metric_utils.metricDataBatchWrite(
+        log=g_log, batchSize=self._PUBLISH_BATCH_SIZE) as putSample:
       for sample in getSamples(aggStartDatetime):
         try:
           putSample(**sample)
@@ -1285,6 +1340,10 @@ class MetricDataForwarder(object):
     the datetime of the last successfully-emitted tweet volume metric batch in
     the database.
 
+    When catching up after an outage, the aggregation intervals are forwarded
+    in chunks of up to _MAX_INTERVALS_PER_CHUNK, and the datetime of the last
+    emitted batch is updated once per chunk.
+
     NOTE: Upon failure during forwarding, an error will be logged, and the
       function will return the UTC timestamp of the last successfully-emitted
       sample aggregation interval. Once destination comes online, a subsequent
@@ -1303,58 +1362,87 @@ class MetricDataForwarder(object):
     periodTimedelta = timedelta(seconds=self._aggSec)
     aggStartDatetime = lastEmittedAggTime + periodTimedelta
 
+    numIntervals = self._countIntervals(aggStartDatetime, stopDatetime)
+    if numIntervals > 1:
+      g_log.info("Catching up on numIntervals=%d of tweet volume metrics from "
+                 "agg=%s", numIntervals, aggStartDatetime)
+
     while aggStartDatetime < stopDatetime:
-      # Aggregate and forward Tweet Volume metrics for one aggregation interval
+      numChunkIntervals = min(
+        self._countIntervals(aggStartDatetime, stopDatetime),
+        self._MAX_INTERVALS_PER_CHUNK)
+      chunkStopDatetime = aggStartDatetime + periodTimedelta * numChunkIntervals
+
+      # Aggregate and forward Tweet Volume metrics for a chunk of aggregation
+      # intervals
       try:
         self.aggregateAndForward(
           aggStartDatetime=aggStartDatetime,
-          stopDatetime=aggStartDatetime + periodTimedelta)
+          stopDatetime=chunkStopDatetime)
       except Exception:  # pylint: disable=W0703
         return lastEmittedAggTime
 
       # Update db with last successfully-emitted datetime
+      lastEmittedAggTime = chunkStopDatetime - periodTimedelta
       metric_utils.updateLastEmittedSampleDatetime(
         key=_EMITTED_TWEET_VOLUME_SAMPLE_TRACKER_KEY,
-        sampleDatetime=aggStartDatetime)
+        sampleDatetime=lastEmittedAggTime)
 
       # Set up for next iteration
-      lastEmittedAggTime = aggStartDatetime
-      aggStartDatetime += periodTimedelta
+      aggStartDatetime = chunkStopDatetime
 
 
     return lastEmittedAggTime
 
 
+  def _countIntervals(self, aggStartDatetime, stopDatetime):
+    """
+    :returns: number of aggregation intervals starting at aggStartDatetime or
+      later and before stopDatetime
+    :rtype: int
+    """
+    rangeSec = date_time_utils.epochFromNaiveUTCDatetime(stopDatetime) - (
+      date_time_utils.epochFromNaiveUTCDatetime(aggStartDatetime))
+    return max(0, int(math.ceil(rangeSec / float(self._aggSec))))
+
+
   @collectorsdb.retryOnTransientErrors
-  def _queryTweetVolumes(self, aggDatetime, metrics):
+  def _queryTweetVolumesInRange(self, aggStartDatetime, stopDatetime, metrics):
     """ Query the database for the counts of tweet metric volumes for the
-    specified aggregation.
+    aggregations in the specified range, as maintained by TweetStorer in the
+    twitter_tweet_volume table.
 
-    :param datetime aggDatetime: aggregation timestamp
+    :param datetime aggStartDatetime: first aggregation timestamp
+    :param datetime stopDatetime: non-inclusive upper bound of aggregation
+      timestamps
     :param metrics: optional sequence of metric names; if specified (non-None),
       the operation will be limited to the given metric names
-    :returns: a sparse sequence of two-tuples: (metric_name, count); metrics
-      that have no tweets in the given aggregation period will be absent from
-      the result.
+    :returns: a sparse dict mapping (aggregation timestamp, metric name) to
+      count; metrics that have no tweets in a given aggregation period will be
+      absent from the result.
     """
+    volumes = schema.twitterTweetVolume
+
     sel = (
-      sql.select([schema.twitterTweetSamples.c.metric, sql.func.count()])
-      .where(schema.twitterTweetSamples.c.agg_ts == aggDatetime)
-      .group_by(schema.twitterTweetSamples.c.metric)
+      sql.select([volumes.c.agg_ts, volumes.c.metric, volumes.c.num_tweets])
+      .where((volumes.c.agg_ts >= aggStartDatetime) &
+             (volumes.c.agg_ts < stopDatetime))
     )
 
     if metrics is not None:
-      sel = sel.where(schema.twitterTweetSamples.c.metric.in_(metrics))
+      sel = sel.where(volumes.c.metric.in_(metrics))
 
-    return self._sqlEngine.execute(sel).fetchall()
+    return dict(((aggTs, metric), count)
+                for aggTs, metric, count in self._sqlEngine.execute(sel))
 
 
 
 class _TweetGarbageCollector(object):
-  """Garbage collector for old tweets in the twitter_tweets table"""
+  """Garbage collector for old tweets in the twitter_tweets table and their
+  counts in the twitter_tweet_volume table"""
 
   # Tweets older than this many days will be deleted from twitter_tweets table
-  # periodically
+  # periodically, along with their counts
   _GC_THRESHOLD_DAYS = 90
 
   # How many seconds to sleep between garbage collection cycles
@@ -1369,6 +1457,9 @@ class _TweetGarbageCollector(object):
       purge_old_tweets.purgeOldTweets(
         thresholdDays=cls._GC_THRESHOLD_DAYS)
 
+      purge_old_tweets.purgeOldTweetVolumeCounts(
+        thresholdDays=cls._GC_THRESHOLD_DAYS)
+
       time.sleep(cls._PAUSE_INTERVAL_SEC)
 
 
@@ -1384,6 +1475,8 @@ def _parseArgs():
     accessTokenSecret
     forwardNonMetric
     echoData
+    tagText
+    numTaggingWorkers
   """
   helpString = (
     "%prog [options]"
@@ -1466,10 +1559,32 @@ def _parseArgs():
     help=("Echo processed Twitter messages to stdout for debugging "
           "[default: %default]"))
 
+  parser.add_option(
+    "--tag-text",
+    action="store_true",
+    default=False,
+    dest="tagText",
+    help=("Also tag tweets on cashtags and mentions in their text, not just "
+          "on their entities [default: %default]"))
+
+  parser.add_option(
+    "--tagging-workers",
+    action="store",
+    type="int",
+    dest="numTaggingWorkers",
+    default=0,
+    help=("Number of worker processes per partition that decode and tag "
+          "streamed messages; 0 to decode and tag them in the tweet storage "
+          "thread [default: %default]"))
+
   options, remainingArgs = parser.parse_args()
   if remainingArgs:
     parser.error("Unexpected remaining args: %r" % (remainingArgs,))
 
+  if options.numTaggingWorkers < 0:
+    parser.error("Number of tagging workers must not be negative, but got %s" %
+                 options.numTaggingWorkers)
+
   if not 0 < options.numPartitions <= 2:
     parser.error("Number of partitions must be either 1 or 2, but got %s" %
                  options.numPartitions)
@@ -1482,7 +1597,9 @@ def _parseArgs():
     accessToken=options.accessToken,
     accessTokenSecret=options.accessTokenSecret,
     forwardNonMetric=options.forwardNonMetric,
-    echoData=options.echoData)
+    echoData=options.echoData,
+    tagText=options.tagText,
+    numTaggingWorkers=options.numTaggingWorkers)
 
 
 
@@ -1504,13 +1621,36 @@ def _partition(l, numParts):
 
 
 
+# Tweet tagging pools by partition index, inherited by stream pool workers from
+# the main process; see _initStreamWorker()
+_g_taggingPools = None
+
+
+
+def _initStreamWorker(taggingPools):
+  """ Initialize the pool worker; called in a multiprocessing pool process
+
+  :param taggingPools: sequence of tweet_tagging.TweetTaggingPool objects by
+    partition index or None if not using tagging workers. NOTE: these must be
+    passed to the pool worker process at creation, because they contain
+    multiprocessing queues.
+  """
+  global _g_taggingPools  # pylint: disable=W0603
+  _g_taggingPools = taggingPools
+
+
+
 @logExceptions(g_log)
 def _runStreamWorker(task):
   """ Run the pool worker; called in a multiprocessing pool process"""
   try:
-    g_log.info("TwitterStreamListener pool worker started; numMetrics=%d",
-               len(task["metricSpecs"]))
-    TwitterStreamListener(**task).run()
+    task = dict(task)
+    partition = task.pop("partition")
+    g_log.info("TwitterStreamListener pool worker started; partition=%d; "
+               "numMetrics=%d", partition, len(task["metricSpecs"]))
+    taggingPool = (_g_taggingPools[partition] if _g_taggingPools is not None
+                   else None)
+    TwitterStreamListener(taggingPool=taggingPool, **task).run()
   except KeyboardInterrupt:
     # Normal exit in response to SIGINT
     g_log.info("KeyboardInterrupt detected, exiting", exc_info=True)
@@ -1562,9 +1702,24 @@ def main():
     # because the collectorsdb engine factory implementation is not fork-safe.
     # The processes must be forked *before* the engine instance is allocated
     # by the engine factory singleton.
+    taggingPools = None
+    if options["numTaggingWorkers"]:
+      # NOTE: stream pool workers can't start processes of their own, so we
+      # start their tagging workers here
+      g_log.info("Starting tweet tagging pools with numWorkers=%d per "
+                 "partition", options["numTaggingWorkers"])
+      taggingPools = [
+        tweet_tagging.TweetTaggingPool(numWorkers=options["numTaggingWorkers"])
+        for _ in xrange(numPartitions)
+      ]
+      for taggingPool in taggingPools:
+        taggingPool.start()
+
     g_log.info("Creating multiprocessing pool with numWorkers=%d",
                numPartitions)
-    workerPool = multiprocessing.Pool(processes=numPartitions)
+    workerPool = multiprocessing.Pool(processes=numPartitions,
+                                      initializer=_initStreamWorker,
+                                      initargs=(taggingPools,))
     try:
 
       metricSpecs = loadMetricSpecs()
@@ -1580,11 +1735,12 @@ def main():
       taskOptions = dict(options.iteritems())
       taskOptions.pop("numPartitions")
       taskOptions.pop("forwardNonMetric")
+      taskOptions.pop("numTaggingWorkers")
 
       tasks = [
         dict(
-          [["metricSpecs", part]] + taskOptions.items())
-        for part in metricPartitions
+          [["metricSpecs", part], ["partition", i]] + taskOptions.items())
+        for i, part in enumerate(metricPartitions)
       ]
 
       # Start tweet streamers
@@ -1644,12 +1800,20 @@ def main():
         if tweetForwarderThread is not None:
           tweetForwarderThread.join(10)
           assert tweetForwarderThread.isAlive()
+
+        if taggingPools is not None:
+          assert all(taggingPool.isAlive() for taggingPool in taggingPools)
     finally:
       # Terminate worker pool. There is no point in trying to close it because
       # our tasks never complete
       g_log.info("Terminating multiprocessing.Pool")
       workerPool.terminate()
       g_log.info("Multiprocessing.Pool terminated")
+
+      if taggingPools is not None:
+        for taggingPool in taggingPools:
+          taggingPool.terminate()
+        g_log.info("Tweet tagging pools terminated")
   except KeyboardInterrupt:
     # Log with exception info to help debug deadlocks
     g_log.info("Observed KeyboardInterrupt", exc_info=True)
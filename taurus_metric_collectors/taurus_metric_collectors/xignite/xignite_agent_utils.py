@@ -38,17 +38,41 @@ def insertSecurity(engine, xigniteSecurity):
   :param dict xigniteSecurity: Security info from xignite API results (e.g., global
     security news, security bars, etc.)
   """
-  secIns = schema.xigniteSecurity.insert(
-    ).prefix_with("IGNORE", dialect="mysql"
-    ).values(symbol=xigniteSecurity["Symbol"].upper(),
-             cik=xigniteSecurity["CIK"],
-             cusip=xigniteSecurity["CUSIP"],
-             isin=xigniteSecurity["ISIN"],
-             valoren=xigniteSecurity["Valoren"],
-             name=xigniteSecurity["Name"],
-             market=xigniteSecurity["Market"],
-             mic=xigniteSecurity["MarketIdentificationCode"],
-             most_liquid_exg=xigniteSecurity["MostLiquidExchange"],
-             industry=xigniteSecurity["CategoryOrIndustry"])
-
-  engine.execute(secIns)
+  engine.execute(_insertSecurityIgnoringDuplicates(),
+                 _createSecurityRow(xigniteSecurity))
+
+
+
+def insertSecurities(conn, xigniteSecurities):
+  """ Insert information about the given securities into xignite_security
+  table, ignoring duplicate keys. NOTE: doesn't retry, so that it may be part of
+  the caller's transaction.
+
+  :param conn: SQLAlchemy connection or engine for executing the query
+  :param xigniteSecurities: sequence of security info dicts from xignite API
+    results
+  """
+  if xigniteSecurities:
+    conn.execute(_insertSecurityIgnoringDuplicates(),
+                 [_createSecurityRow(security)
+                  for security in xigniteSecurities])
+
+
+
+def _insertSecurityIgnoringDuplicates():
+  return schema.xigniteSecurity.insert().prefix_with("IGNORE", dialect="mysql")
+
+
+
+def _createSecurityRow(xigniteSecurity):
+  """ :returns: xignite_security row dict from xignite API security info """
+  return dict(symbol=xigniteSecurity["Symbol"].upper(),
+              cik=xigniteSecurity["CIK"],
+              cusip=xigniteSecurity["CUSIP"],
+              isin=xigniteSecurity["ISIN"],
+              valoren=xigniteSecurity["Valoren"],
+              name=xigniteSecurity["Name"],
+              market=xigniteSecurity["Market"],
+              mic=xigniteSecurity["MarketIdentificationCode"],
+              most_liquid_exg=xigniteSecurity["MostLiquidExchange"],
+              industry=xigniteSecurity["CategoryOrIndustry"])
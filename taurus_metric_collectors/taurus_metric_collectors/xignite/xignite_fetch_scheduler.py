@@ -0,0 +1,221 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Concurrent, rate-limited scheduling of per-symbol XIgnite API requests.
+"""
+
+from multiprocessing.pool import ThreadPool
+import threading
+import time
+
+import requests
+
+from nta.utils.extended_logger import ExtendedLogger
+
+
+
+_LOG = ExtendedLogger.getExtendedLogger(__name__)
+
+
+
+class TokenBucket(object):
+  """ Thread-safe token bucket rate limiter: allows bursts of up to `capacity`
+  requests and `ratePerSec` requests per second on average.
+  """
+
+  def __init__(self, ratePerSec, capacity, clock=time.time, sleep=time.sleep):
+    """
+    :param float ratePerSec: rate at which tokens are added to the bucket
+    :param int capacity: maximum number of tokens in the bucket; the bucket
+      starts out full
+    :param clock: function returning the current time in seconds
+    :param sleep: function that sleeps for the given number of seconds
+    """
+    if ratePerSec <= 0:
+      raise ValueError("ratePerSec must be positive, but got %r" %
+                       (ratePerSec,))
+    if capacity < 1:
+      raise ValueError("capacity must be at least 1, but got %r" % (capacity,))
+
+    self._ratePerSec = float(ratePerSec)
+    self._capacity = capacity
+    self._clock = clock
+    self._sleep = sleep
+
+    self._lock = threading.Lock()
+    self._tokens = float(capacity)
+    self._lastRefillTime = clock()
+
+
+  def acquire(self):
+    """ Take a token from the bucket, waiting for one if the bucket is empty """
+    with self._lock:
+      now = self._clock()
+      self._tokens = min(
+        self._capacity,
+        self._tokens + (now - self._lastRefillTime) * self._ratePerSec)
+      self._lastRefillTime = now
+
+      # NOTE: the token is reserved right away, possibly making the balance
+      # negative, so that concurrent callers queue up behind one another
+      # instead of competing for the same refill
+      self._tokens -= 1
+      waitSec = -self._tokens / self._ratePerSec if self._tokens < 0 else 0
+
+    if waitSec > 0:
+      self._sleep(waitSec)
+
+
+
+class SymbolBackoff(object):
+  """ Exponential backoff of symbols whose requests failed, so that failing
+  symbols don't use up the API budget of the others.
+  """
+
+  def __init__(self, initialDelaySec, maxDelaySec, clock=time.time):
+    """
+    :param initialDelaySec: delay after the first consecutive failure of a
+      symbol; doubles with each subsequent consecutive failure
+    :param maxDelaySec: maximum delay
+    :param clock: function returning the current time in seconds
+    """
+    self._initialDelaySec = initialDelaySec
+    self._maxDelaySec = maxDelaySec
+    self._clock = clock
+
+    self._lock = threading.Lock()
+
+    # Symbol to (number of consecutive failures, time of next attempt)
+    self._failures = dict()
+
+
+  def isReady(self, symbol):
+    """ :returns: True if the symbol isn't backing off """
+    with self._lock:
+      failure = self._failures.get(symbol)
+      return failure is None or self._clock() >= failure[1]
+
+
+  def recordSuccess(self, symbol):
+    with self._lock:
+      self._failures.pop(symbol, None)
+
+
+  def recordFailure(self, symbol):
+    """ :returns: number of seconds that the symbol will be backing off """
+    with self._lock:
+      numFailures = self._failures.get(symbol, (0, None))[0] + 1
+      delaySec = min(self._initialDelaySec * 2 ** (numFailures - 1),
+                     self._maxDelaySec)
+      self._failures[symbol] = (numFailures, self._clock() + delaySec)
+      return delaySec
+
+
+
+class XigniteFetchScheduler(object):
+  """ Runs per-symbol fetch functions concurrently in a thread pool, subject
+  to a global TokenBucket rate limit of API requests and per-symbol
+  SymbolBackoff. Each thread reuses its own HTTP connections via a
+  requests.Session.
+  """
+
+  def __init__(self, numThreads, maxRequestsPerSec, initialBackoffSec,
+               maxBackoffSec):
+    """
+    :param int numThreads: number of concurrent fetches
+    :param float maxRequestsPerSec: maximum average rate of API requests; also
+      the maximum burst
+    :param initialBackoffSec: backoff of a symbol after its first consecutive
+      failure
+    :param maxBackoffSec: maximum backoff of a symbol
+    """
+    self._threadPool = ThreadPool(processes=numThreads)
+    self._rateLimiter = TokenBucket(ratePerSec=maxRequestsPerSec,
+                                    capacity=max(1, int(maxRequestsPerSec)))
+    self._backoff = SymbolBackoff(initialDelaySec=initialBackoffSec,
+                                  maxDelaySec=maxBackoffSec)
+    self._threadLocal = threading.local()
+
+
+  def close(self):
+    """ Stop the thread pool """
+    self._threadPool.terminate()
+    self._threadPool.join()
+
+
+  def _getHttpSession(self):
+    """ :returns: the calling thread's requests.Session """
+    httpSession = getattr(self._threadLocal, "httpSession", None)
+    if httpSession is None:
+      httpSession = self._threadLocal.httpSession = requests.Session()
+
+    return httpSession
+
+
+  def fetchAll(self, symbolToArgs, fetchFn):
+    """ Fetch data of the given symbols concurrently; symbols that are backing
+    off after failures are skipped
+
+    :param dict symbolToArgs: symbol to the argument for fetchFn
+    :param fetchFn: function `fetchFn(arg, httpSession, rateLimit)` that
+      fetches data of one symbol: `arg` is the symbol's value from
+      symbolToArgs; `httpSession` is the calling thread's requests.Session;
+      and `rateLimit()` must be called before each API request. Failure is
+      reported by raising an exception.
+
+    :returns: symbol to fetchFn result for the successful fetches
+    :rtype: dict
+    """
+    readySymbols = [symbol for symbol in symbolToArgs
+                    if self._backoff.isReady(symbol)]
+    if len(readySymbols) < len(symbolToArgs):
+      _LOG.info("Skipping numSymbols=%d in backoff",
+                len(symbolToArgs) - len(readySymbols))
+
+    def fetchSymbol(symbol):
+      try:
+        result = fetchFn(symbolToArgs[symbol],
+                         httpSession=self._getHttpSession(),
+                         rateLimit=self._rateLimiter.acquire)
+      except Exception:  # pylint: disable=W0703
+        delaySec = self._backoff.recordFailure(symbol)
+        _LOG.exception("Fetch failed for symbol=%s; backing off for %ss",
+                       symbol, delaySec)
+        return symbol, False, None
+      else:
+        self._backoff.recordSuccess(symbol)
+        return symbol, True, result
+
+    return dict(
+      (symbol, result)
+      for symbol, succeeded, result in self._threadPool.imap_unordered(
+        fetchSymbol, readySymbols)
+      if succeeded)
+
+
+  def map(self, fn, iterable):
+    """ Apply the function to each item concurrently in the thread pool,
+    without rate limiting
+
+    :returns: list of results
+    """
+    return self._threadPool.map(fn, iterable)
@@ -27,7 +27,6 @@ import datetime
 from functools import partial
 import itertools
 import json
-from multiprocessing import Pool
 from optparse import OptionParser
 import os
 import Queue
@@ -57,6 +56,8 @@ from taurus_metric_collectors.collectorsdb.schema import (xigniteSecurity,
                                                           emittedStockPrice,
                                                           emittedStockVolume)
 from taurus_metric_collectors.xignite import xignite_agent_utils
+from taurus_metric_collectors.xignite.xignite_fetch_scheduler import (
+  XigniteFetchScheduler)
 
 
 
@@ -68,6 +69,11 @@ DEFAULT_SERVER = os.environ.get("TAURUS_HTM_SERVER", "127.0.0.1")
 DEFAULT_PORT = 2003
 DEFAULT_DAYS = 20
 DEFAULT_DRYRUN = False
+DEFAULT_FETCH_THREADS = 10
+DEFAULT_MAX_REQUESTS_PER_SEC = 10.0
+
+# Maximum backoff of a symbol whose XIgnite API requests keep failing
+_MAX_SYMBOL_BACKOFF_SEC = 3600
 
 NAIVE_MARKET_OPEN_TIME = datetime.time(9, 30)    # 9:30 AM
 NAIVE_MARKET_CLOSE_TIME = datetime.time(16, 00)  # 4 PM
@@ -123,6 +129,12 @@ g_opMode = ApplicationConfig().get("xignite_stock_agent", "opmode")
 
 
 
+class XigniteApiError(Exception):
+  """ XIgnite API reported failure of a request """
+  pass
+
+
+
 def getEasternLocalizedTimestampFromSample(date, time, offset):
   """ Get a timestamp localized to US/Eastern from XIgnite GetBars sample
 
@@ -271,6 +283,54 @@ def getData(symbol, apitoken, barlength, startTime, endTime, fields):
     }
   """
 
+  queryString = urllib.urlencode(
+    _createGetBarsQuery(symbol=symbol,
+                        apitoken=apitoken,
+                        barlength=barlength,
+                        startTime=startTime,
+                        endTime=endTime,
+                        fields=fields))
+
+  response = urllib2.urlopen(_API_URL + queryString,
+                             timeout=URLOPEN_TIMEOUT_SEC)
+
+  return json.loads(response.read())
+
+
+
+def getDataWithSession(httpSession, symbol, apitoken, barlength, startTime,
+                       endTime, fields):
+  """ Request data from XigniteGlobalQuotes GetBars API like `getData()`, but
+  via the given requests.Session, reusing its connections
+
+  :param requests.Session httpSession:
+
+  See `getData()` for the other params and the response.
+
+  :raises requests.exceptions.RequestException: on connection failure or error
+    response status
+  """
+  response = httpSession.get(
+    _API_URL,
+    params=_createGetBarsQuery(symbol=symbol,
+                               apitoken=apitoken,
+                               barlength=barlength,
+                               startTime=startTime,
+                               endTime=endTime,
+                               fields=fields),
+    timeout=URLOPEN_TIMEOUT_SEC)
+
+  response.raise_for_status()
+
+  return json.loads(response.text)
+
+
+
+def _createGetBarsQuery(symbol, apitoken, barlength, startTime, endTime,
+                        fields):
+  """ :returns: query params dict of XigniteGlobalQuotes GetBars API request;
+  see `getData()` for param details
+  """
   query = copy.deepcopy(_URL_KEYS)
   query.update({"Identifier": symbol,
                 "StartTime": startTime,
@@ -278,13 +338,7 @@ def getData(symbol, apitoken, barlength, startTime, endTime, fields):
                 "Period": barlength,
                 "_Token": apitoken,
                 "_fields": ",".join(fields)})
-
-  queryString = urllib.urlencode(query)
-
-  response = urllib2.urlopen(_API_URL + queryString,
-                             timeout=URLOPEN_TIMEOUT_SEC)
-
-  return json.loads(response.read())
+  return query
 
 
 
@@ -336,89 +390,17 @@ def poll(metricSpecs, apitoken, barlength, days):
   try:
     symbol = metricSpecs[0].symbol
 
-    now = datetime.datetime.now(_UTC_TZ) # Now, in UTC time
-    now -= datetime.timedelta(minutes=(barlength + now.minute % barlength),
-                              seconds=now.second) # Align and pad end time to
-                                         # prevent too recent of a bucket from
-                                         # being returned
-
-    engine = collectorsdb.engineFactory()
-    lastSample = _getLatestSample(engine, symbol)
-
-    if lastSample:
-      localizedLastEndTime = (
-        getEasternLocalizedEndTimestampFromSampleRow(lastSample))
-
-    else:
-      # Need to bootstrap from existing file-based .history/ approach
-      symbolFilename = getSymbolFilename(symbol)
-      if os.path.isfile(symbolFilename):
-        # TODO: TAUR-779 Remove this case once we've successfully migrated
-        # away from file-based approach.
-        with open(symbolFilename, "r+") as symbolFile:
-          try:
-            # Seek to end of file for latest sample
-            lastline = StringIO(symbolFile.readlines()[-1])
-            csvin = csv.reader(lastline)
-            lastSample = dict(zip(_COLS, next(csvin)))
-            localizedLastEndTime = (
-              getEasternLocalizedTimestampFromSample(lastSample["EndDate"],
-                                                     lastSample["EndTime"],
-                                                     lastSample["UTCOffset"]))
-
-          except IndexError:
-            # File is empty
-            lastSample = {}
-            localizedLastEndTime = (
-              ((now - datetime.timedelta(days=days)).astimezone(_EASTERN_TZ)))
-      else:
-        localizedLastEndTime = (
-          ((now - datetime.timedelta(days=days)).astimezone(_EASTERN_TZ)))
-
-
-    # Set start time to match last end, and end to be now
-    # Use Eastern because that's what XIgnite assumes in the API
-    localizedStartTime = localizedLastEndTime
-    localizedEndTime = now.astimezone(_EASTERN_TZ)
+    lastSample, localizedLastEndTime, localizedEndTime = (
+      _getPollingTimeRange(symbol=symbol, barlength=barlength, days=days))
 
     # Fetch XIgnite data
-
-    fields = ["Outcome",
-              "Message",
-              "Identity",
-              "Delay",
-              "Security",
-              "Security.CIK",
-              "Security.CUSIP",
-              "Security.Symbol",
-              "Security.ISIN",
-              "Security.Valoren",
-              "Security.Name",
-              "Security.Market",
-              "Security.MarketIdentificationCode",
-              "Security.MostLiquidExchange",
-              "Security.CategoryOrIndustry",
-              "Bars",
-              "Bars.StartDate",
-              "Bars.StartTime",
-              "Bars.EndDate",
-              "Bars.EndTime",
-              "Bars.UTCOffset",
-              "Bars.Open",
-              "Bars.High",
-              "Bars.Low",
-              "Bars.Trades"]
-
-    for spec in metricSpecs:
-      fields.append("Bars.%s" % (spec.sampleKey,))
-
     try:
       data = getData(symbol=symbol,
                      apitoken=apitoken,
                      barlength=barlength,
-                     startTime=localizedStartTime.strftime(DATE_FMT),
+                     startTime=localizedLastEndTime.strftime(DATE_FMT),
                      endTime=localizedEndTime.strftime(DATE_FMT),
-                     fields=fields)
+                     fields=_getBarsFields(metricSpecs))
     except Exception as e:
       _LOG.exception("Unexpected error while retrieving data from XIgnite.")
       return {"Symbol": symbol}, []
@@ -426,21 +408,9 @@ def poll(metricSpecs, apitoken, barlength, days):
     if (data and "Bars" in data and "Outcome" in data and
         data["Outcome"] == "Success"):
       # Return only the new data
-
-
-      def sampleStartIsGreaterThanOrEqualToLastEndTime(sample):
-        # Compare w/ consistent timezones.
-        return (
-          getEasternLocalizedTimestampFromSample(sample["StartDate"],
-                                                 sample["StartTime"],
-                                                 sample["UTCOffset"])
-          >= localizedLastEndTime)
-
-
       return (data["Security"],
-              [sample for sample in data["Bars"]
-               if (not lastSample or
-                   sampleStartIsGreaterThanOrEqualToLastEndTime(sample))])
+              _selectNewSamples(data["Bars"], lastSample,
+                                localizedLastEndTime))
 
     else:
       return {"Symbol": symbol}, []
@@ -449,6 +419,162 @@ def poll(metricSpecs, apitoken, barlength, days):
     raise
 
 
+
+def _pollWithSession(metricSpecs, httpSession, rateLimit, apitoken, barlength,
+                     days):
+  """ Poll XIgnite data for given metricspecs associated with the same symbol
+  like `poll()`, but via the given requests.Session and raising on failure;
+  used with XigniteFetchScheduler
+
+  :param metricSpecs: Sequence of one or more StockMetricSpec objects
+    associated with the same stock symbol for which to conduct polling
+  :param requests.Session httpSession:
+  :param rateLimit: function to call before the API request
+  :param apitoken: XIgnite API Token
+  :param barlength: Aggregation time period (in minutes)
+  :param days: Number of days to request
+
+  :returns: security details (dict), and new data as a sequence of dicts
+  :rtype: 2-tuple
+  :raises XigniteApiError: if XIgnite reports failure of the request
+  """
+  symbol = metricSpecs[0].symbol
+
+  lastSample, localizedLastEndTime, localizedEndTime = (
+    _getPollingTimeRange(symbol=symbol, barlength=barlength, days=days))
+
+  rateLimit()
+  data = getDataWithSession(httpSession=httpSession,
+                            symbol=symbol,
+                            apitoken=apitoken,
+                            barlength=barlength,
+                            startTime=localizedLastEndTime.strftime(DATE_FMT),
+                            endTime=localizedEndTime.strftime(DATE_FMT),
+                            fields=_getBarsFields(metricSpecs))
+
+  if not data or data.get("Outcome") != "Success" or "Bars" not in data:
+    raise XigniteApiError("GetBars failed for symbol=%s: outcome=%s, "
+                          "message=%s" % (symbol, data and data.get("Outcome"),
+                                          data and data.get("Message")))
+
+  return (data["Security"],
+          _selectNewSamples(data["Bars"], lastSample, localizedLastEndTime))
+
+
+
+def _getPollingTimeRange(symbol, barlength, days):
+  """ Determine the time range of new data to poll for the given symbol
+
+  :param symbol: Stock symbol
+  :param barlength: Aggregation time period (in minutes)
+  :param days: Number of days to request when there is no previous data
+
+  :returns: 3-tuple (lastSample, localizedLastEndTime, localizedEndTime):
+    lastSample - the latest previously fetched sample, if any
+    localizedLastEndTime - US/Eastern end time of lastSample, or the start of
+      the backlog period if there is no previous sample
+    localizedEndTime - US/Eastern end time of the range
+  """
+  now = datetime.datetime.now(_UTC_TZ) # Now, in UTC time
+  now -= datetime.timedelta(minutes=(barlength + now.minute % barlength),
+                            seconds=now.second) # Align and pad end time to
+                                       # prevent too recent of a bucket from
+                                       # being returned
+
+  engine = collectorsdb.engineFactory()
+  lastSample = _getLatestSample(engine, symbol)
+
+  if lastSample:
+    localizedLastEndTime = (
+      getEasternLocalizedEndTimestampFromSampleRow(lastSample))
+
+  else:
+    # Need to bootstrap from existing file-based .history/ approach
+    symbolFilename = getSymbolFilename(symbol)
+    if os.path.isfile(symbolFilename):
+      # TODO: TAUR-779 Remove this case once we've successfully migrated
+      # away from file-based approach.
+      with open(symbolFilename, "r+") as symbolFile:
+        try:
+          # Seek to end of file for latest sample
+          lastline = StringIO(symbolFile.readlines()[-1])
+          csvin = csv.reader(lastline)
+          lastSample = dict(zip(_COLS, next(csvin)))
+          localizedLastEndTime = (
+            getEasternLocalizedTimestampFromSample(lastSample["EndDate"],
+                                                   lastSample["EndTime"],
+                                                   lastSample["UTCOffset"]))
+
+        except IndexError:
+          # File is empty
+          lastSample = {}
+          localizedLastEndTime = (
+            ((now - datetime.timedelta(days=days)).astimezone(_EASTERN_TZ)))
+    else:
+      localizedLastEndTime = (
+        ((now - datetime.timedelta(days=days)).astimezone(_EASTERN_TZ)))
+
+  # Set start time to match last end, and end to be now
+  # Use Eastern because that's what XIgnite assumes in the API
+  return lastSample, localizedLastEndTime, now.astimezone(_EASTERN_TZ)
+
+
+
+def _getBarsFields(metricSpecs):
+  """ :returns: XIgnite GetBars API field names to request for the given
+  StockMetricSpec objects of a symbol
+  """
+  fields = ["Outcome",
+            "Message",
+            "Identity",
+            "Delay",
+            "Security",
+            "Security.CIK",
+            "Security.CUSIP",
+            "Security.Symbol",
+            "Security.ISIN",
+            "Security.Valoren",
+            "Security.Name",
+            "Security.Market",
+            "Security.MarketIdentificationCode",
+            "Security.MostLiquidExchange",
+            "Security.CategoryOrIndustry",
+            "Bars",
+            "Bars.StartDate",
+            "Bars.StartTime",
+            "Bars.EndDate",
+            "Bars.EndTime",
+            "Bars.UTCOffset",
+            "Bars.Open",
+            "Bars.High",
+            "Bars.Low",
+            "Bars.Trades"]
+
+  for spec in metricSpecs:
+    fields.append("Bars.%s" % (spec.sampleKey,))
+
+  return fields
+
+
+
+def _selectNewSamples(samples, lastSample, localizedLastEndTime):
+  """ :returns: the samples that start at or after the end of the previously
+  fetched sample; all samples if there is no previous sample
+  """
+  if not lastSample:
+    return list(samples)
+
+  # Compare w/ consistent timezones.
+  return [
+    sample for sample in samples
+    if (getEasternLocalizedTimestampFromSample(sample["StartDate"],
+                                               sample["StartTime"],
+                                               sample["UTCOffset"])
+        >= localizedLastEndTime)
+  ]
+
+
+
 def forward(metricSpecs, data, security, server=DEFAULT_SERVER,
             port=DEFAULT_PORT,
             dryrun=DEFAULT_DRYRUN):
@@ -476,46 +602,16 @@ def forward(metricSpecs, data, security, server=DEFAULT_SERVER,
     # 1. Buffer records to collectorsdb
 
     for sample in data:
-      localizedSampleStartTime = (
-        getEasternLocalizedTimestampFromSample(sample["StartDate"],
-                                               sample["StartTime"],
-                                               sample["UTCOffset"]))
-
-      if localizedSampleStartTime.time() < NAIVE_MARKET_OPEN_TIME:
-        # Ignore samples that preceed market open
-        _LOG.info("Skipping data before market hours: %s @ %s sample=%s",
-                  symbol, localizedSampleStartTime, sample)
+      barRow = _createBarRow(symbol, sample)
+      if barRow is None:
         continue
 
-      if localizedSampleStartTime.time() >= NAIVE_MARKET_CLOSE_TIME:
-        # Ignore a quirk of the xignite API that duplicates some data at
-        # end of trading day. This also excludes the closing auction on
-        # NYSE.
-        _LOG.info("Skipping data after market hours: %s @ %s sample=%s",
-                  symbol, localizedSampleStartTime, sample)
-        continue
+      localizedSampleStartTime = _EASTERN_TZ.localize(
+        datetime.datetime.combine(barRow["StartDate"], barRow["StartTime"]))
 
       if not lastSample or (localizedSampleStartTime >= localizedLastEndTime):
         # Current sample starts at, or after last recorded timestamp ends
-        localizedSampleEndTime = (
-          getEasternLocalizedTimestampFromSample(sample["EndDate"],
-                                                 sample["EndTime"],
-                                                 sample["UTCOffset"]))
-
-        ins = (xigniteSecurityBars
-               .insert()
-               .values(symbol=symbol,
-                       StartDate=localizedSampleStartTime.date(),
-                       StartTime=localizedSampleStartTime.time(),
-                       EndDate=localizedSampleEndTime.date(),
-                       EndTime=localizedSampleEndTime.time(),
-                       UTCOffset=sample["UTCOffset"],
-                       Open=sample["Open"],
-                       High=sample["High"],
-                       Low=sample["Low"],
-                       Close=sample["Close"],
-                       Volume=sample["Volume"],
-                       Trades=sample["Trades"]))
+        ins = xigniteSecurityBars.insert().values(**barRow)
 
         @collectorsdb.retryOnTransientErrors
         def _insertBar():
@@ -545,6 +641,90 @@ def forward(metricSpecs, data, security, server=DEFAULT_SERVER,
 
 
 
+def _createBarRow(symbol, sample):
+  """ Create an xignite_security_bars row from the given sample, unless the
+  sample is outside market hours
+
+  :param symbol: Stock symbol
+  :param dict sample: sample from XIgnite GetBars API
+  :returns: row dict or None if the sample is to be skipped
+  """
+  localizedSampleStartTime = (
+    getEasternLocalizedTimestampFromSample(sample["StartDate"],
+                                           sample["StartTime"],
+                                           sample["UTCOffset"]))
+
+  if localizedSampleStartTime.time() < NAIVE_MARKET_OPEN_TIME:
+    # Ignore samples that preceed market open
+    _LOG.info("Skipping data before market hours: %s @ %s sample=%s",
+              symbol, localizedSampleStartTime, sample)
+    return None
+
+  if localizedSampleStartTime.time() >= NAIVE_MARKET_CLOSE_TIME:
+    # Ignore a quirk of the xignite API that duplicates some data at
+    # end of trading day. This also excludes the closing auction on
+    # NYSE.
+    _LOG.info("Skipping data after market hours: %s @ %s sample=%s",
+              symbol, localizedSampleStartTime, sample)
+    return None
+
+  localizedSampleEndTime = (
+    getEasternLocalizedTimestampFromSample(sample["EndDate"],
+                                           sample["EndTime"],
+                                           sample["UTCOffset"]))
+
+  return dict(symbol=symbol,
+              StartDate=localizedSampleStartTime.date(),
+              StartTime=localizedSampleStartTime.time(),
+              EndDate=localizedSampleEndTime.date(),
+              EndTime=localizedSampleEndTime.time(),
+              UTCOffset=sample["UTCOffset"],
+              Open=sample["Open"],
+              High=sample["High"],
+              Low=sample["Low"],
+              Close=sample["Close"],
+              Volume=sample["Volume"],
+              Trades=sample["Trades"])
+
+
+
+@collectorsdb.retryOnTransientErrors
+def _saveNewBars(engine, pollResults):
+  """ Save the new bars of all the given symbols in a single transaction,
+  along with their xignite_security rows
+
+  :param sqlalchemy.engine.Engine engine:
+  :param pollResults: sequence of (security, data) pairs as returned by
+    `poll()` with data relative to the latest saved bars
+
+  :returns: symbols that had new bars
+  :rtype: list
+  """
+  securities = []
+  barRows = []
+  for security, data in pollResults:
+    symbol = security["Symbol"]
+    symbolBarRows = [row for row in (_createBarRow(symbol, sample)
+                                     for sample in data)
+                     if row is not None]
+    if symbolBarRows:
+      securities.append(security)
+      barRows.extend(symbolBarRows)
+
+  if barRows:
+    with engine.begin() as conn:
+      xignite_agent_utils.insertSecurities(conn, securities)
+
+      # NOTE: ignore duplicates, so that a bar that was already saved doesn't
+      # fail the whole batch
+      conn.execute(
+        xigniteSecurityBars.insert().prefix_with("IGNORE", dialect="mysql"),
+        barRows)
+
+  return [security["Symbol"] for security in securities]
+
+
+
 def transmitMetricData(metricSpecs, symbol, engine):
   """ Send unsent metric data samples for the given symbol to Taurus
 
@@ -699,21 +879,19 @@ def main():
 
   options = _parseArgs()
 
-  # Bind poll() kwargs to CLI options
-  pollFn = partial(poll,
+  # Bind _pollWithSession() kwargs to CLI options
+  pollFn = partial(_pollWithSession,
                    apitoken=options.apitoken,
                    barlength=options.barlength,
                    days=options.days)
 
-  # Bind forward() kwargs to CLI options
-  forwardFn = partial(forward,
-                      server=options.server,
-                      port=options.port,
-                      dryrun=options.dryrun)
+  cycleDuration = 60 * options.barlength
 
-  pool = Pool()
-
-  sleepDuration = 60 * options.barlength
+  scheduler = XigniteFetchScheduler(
+    numThreads=options.fetchThreads,
+    maxRequestsPerSec=options.maxRequestsPerSec,
+    initialBackoffSec=cycleDuration,
+    maxBackoffSec=_MAX_SYMBOL_BACKOFF_SEC)
 
   # Load metric specs from metric configuration
   symbolToMetricSpecs = defaultdict(list)
@@ -724,46 +902,78 @@ def main():
 
   try:
     while True:
-      # Run poll() for each symbol in the process pool
-      pendingAsyncResults = []
-      for security, data in pool.imap_unordered(
-          pollFn,
-          symbolToMetricSpecs.itervalues()):
-        # Forward result (if available) to HTM-IT/Taurus instance
-        if data:
-          pendingAsyncResults.append(
-            pool.apply_async(
-              forwardFn,
-              (symbolToMetricSpecs[security["Symbol"]], data, security)))
-        else:
-          _LOG.info("No new data for %s", security["Symbol"])
-
-
-      # Run garbage collection on our tables
-      pendingAsyncResults.append(pool.apply_async(_purgeOldRecords))
+      cycleStartTime = time.time()
+
+      _runPollingCycle(scheduler=scheduler,
+                       pollFn=pollFn,
+                       symbolToMetricSpecs=symbolToMetricSpecs)
 
+      sleepDuration = max(0, cycleDuration - (time.time() - cycleStartTime))
       _LOG.info("Sleeping for %d seconds. zzzzzzzz....", sleepDuration)
       time.sleep(sleepDuration)
 
-      # Wait for all async tasks to complete to avoid out-of-order metric data
-      if pendingAsyncResults:
-        for r in pendingAsyncResults:
-          try:
-            r.get()
-          except Exception:
-            # Async task failed - log and suppress
-            _LOG.exception("Async task failed.")
-
-        _LOG.info("Async numTasks=%d completed", len(pendingAsyncResults))
-
   except KeyboardInterrupt:
     # Log the traceback to help with debugging in case we were deadlocked
     _LOG.info("KeyboardInterrupt detected, exiting...", exc_info=True)
     pass
 
   finally:
-    pool.close()
-    pool.join()
+    scheduler.close()
+
+
+
+def _runPollingCycle(scheduler, pollFn, symbolToMetricSpecs):
+  """ Poll all symbols concurrently, save their new bars in a single
+  transaction, forward unsent data to Taurus and garbage-collect old records
+
+  :param XigniteFetchScheduler scheduler:
+  :param pollFn: `_pollWithSession()` with bound CLI options
+  :param dict symbolToMetricSpecs: stock symbol to sequence of StockMetricSpec
+    objects
+  """
+  cycleStartTime = time.time()
+
+  symbolToPollResult = scheduler.fetchAll(symbolToMetricSpecs, pollFn)
+
+  pollResults = []
+  for symbol, (security, data) in symbolToPollResult.iteritems():
+    if data:
+      pollResults.append((security, data))
+    else:
+      _LOG.info("No new data for %s", symbol)
+
+  _LOG.info("Polled numSymbols=%d of %d; numWithNewData=%d in %.1fs",
+            len(symbolToPollResult), len(symbolToMetricSpecs),
+            len(pollResults), time.time() - cycleStartTime)
+
+  engine = collectorsdb.engineFactory()
+
+  try:
+    savedSymbols = _saveNewBars(engine, pollResults)
+    _LOG.info("Saved new bars of numSymbols=%d", len(savedSymbols))
+  except Exception:
+    # NOTE: the unsaved bars will be fetched again in the next cycle, since
+    # polling starts at the latest saved bar
+    _LOG.exception("Failed to save bars of numSymbols=%d", len(pollResults))
+    savedSymbols = []
+
+  # If in active mode, send ALL un-sent records to Taurus
+  if g_opMode == ApplicationConfig.OP_MODE_ACTIVE:
+    scheduler.map(
+      lambda symbol: transmitMetricData(
+        metricSpecs=symbolToMetricSpecs[symbol],
+        symbol=symbol,
+        engine=engine),
+      savedSymbols)
+
+  # Run garbage collection on our tables
+  try:
+    _purgeOldRecords()
+  except Exception:
+    # Already logged by _purgeOldRecords() - suppress
+    pass
+
+  _LOG.info("Completed polling cycle in %.1fs", time.time() - cycleStartTime)
 
 
 
@@ -812,6 +1022,22 @@ def _parseArgs():
       dest="dryrun",
       help="Use this flag to do a dry run [default: %default]")
 
+  parser.add_option(
+      "--fetch-threads",
+      action="store",
+      type="int",
+      default=DEFAULT_FETCH_THREADS,
+      dest="fetchThreads",
+      help="Number of concurrent XIgnite API requests [default: %default]")
+
+  parser.add_option(
+      "--max-requests-per-sec",
+      action="store",
+      type="float",
+      default=DEFAULT_MAX_REQUESTS_PER_SEC,
+      dest="maxRequestsPerSec",
+      help="Maximum rate of XIgnite API requests [default: %default]")
+
   parser.add_option(
       "--apitoken",
       action="store",
@@ -825,6 +1051,12 @@ def _parseArgs():
   if not options.apitoken:
     parser.error("Missing required XIgnite API Token")
 
+  if options.fetchThreads < 1:
+    parser.error("--fetch-threads must be positive")
+
+  if options.maxRequestsPerSec <= 0:
+    parser.error("--max-requests-per-sec must be positive")
+
   return options
 
 
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Benchmark decoding and tagging of streamed twitter messages in tweets/sec:
+the former tagging closures versus TweetTagger in the tweet storage thread,
+and versus TweetTaggingPool worker processes. The pool only helps when there
+are spare CPU cores for its workers; the reported CPU time of the storer
+process shows how much work is taken off the tweet storage thread.
+
+The sample stream is read from --sample, a file of raw messages recorded from
+the Twitter Streaming API, one JSON message per line; e.g.,
+  curl ... https://stream.twitter.com/1.1/statuses/filter.json > sample.json
+
+Without --sample, a synthetic stream of tweets is generated.
+"""
+
+import json
+from optparse import OptionParser
+import random
+import time
+
+from taurus_metric_collectors.twitterdirect.tweet_tagging import (
+  decodeAndTagMessages,
+  TweetTagger,
+  TweetTaggingPool)
+
+
+
+def _formerTagOnSymbols(msg, mappings):
+  entities = msg.get("entities")
+  if not entities:
+    return
+  symbols = entities.get("symbols")
+  if not symbols:
+    return
+
+  for sym in symbols:
+    ticker = sym.get("text")
+    if not ticker:
+      continue
+    metricName = mappings.get(ticker.lower())
+    if metricName:
+      msg["metricTagSet"].add(metricName)
+
+
+
+def _formerTagOnSourceUsers(msg, mappings):
+  userObj = msg.get("user")
+  if not userObj:
+    return
+  idStr = userObj.get("id_str")
+  metricNames = mappings.get(idStr)
+  if metricNames:
+    msg["metricTagSet"].update(metricNames)
+
+
+
+def _formerTagOnMentions(msg, mappings):
+  entities = msg.get("entities")
+  if not entities:
+    return
+  userMentions = entities.get("user_mentions")
+  if not userMentions:
+    return
+
+  for mention in userMentions:
+    idStr = mention.get("id_str")
+    metricNames = mappings.get(idStr)
+    if metricNames:
+      msg["metricTagSet"].update(metricNames)
+
+
+
+def _decodeAndTagFormer(taggingMap, messages):
+  """ The former processing in TweetStorer._reapMessages: decode, then run
+  every tagging closure over every tweet
+
+  :returns: list of metricTagSet of each tweet
+  """
+  tagSets = []
+  for data in messages:
+    msg = json.loads(data)
+    if "in_reply_to_status_id" in msg:
+      msg["metricTagSet"] = set()
+      for tagger, mappings in taggingMap.iteritems():
+        tagger(msg, mappings)
+      tagSets.append(msg["metricTagSet"])
+
+  return tagSets
+
+
+
+def _decodeAndTag(tagger, messages):
+  # NOTE: in batches like TweetStorer, so that the decoded messages don't
+  # accumulate
+  tagSets = []
+  for i in xrange(0, len(messages), TweetTaggingPool._MAX_BATCH_SIZE):
+    tagSets.extend(
+      msg["metricTagSet"]
+      for msg in decodeAndTagMessages(
+        tagger, messages[i:i + TweetTaggingPool._MAX_BATCH_SIZE])
+      if "in_reply_to_status_id" in msg)
+
+  return tagSets
+
+
+
+def _decodeAndTagInPool(taggingPool, messages):
+  for i in xrange(0, len(messages), TweetTaggingPool._MAX_BATCH_SIZE):
+    taggingPool.submit(messages[i:i + TweetTaggingPool._MAX_BATCH_SIZE])
+
+  tagSets = []
+  for _ in xrange(len(messages)):
+    msg = taggingPool.get()
+    if "in_reply_to_status_id" in msg:
+      tagSets.append(msg["metricTagSet"])
+
+  return tagSets
+
+
+
+def _loadSample(path):
+  with open(path) as sampleFile:
+    return [line.strip() for line in sampleFile if line.strip()]
+
+
+
+def _generateSample(numTweets, symbols, userIds, rng):
+  """ :returns: raw JSON messages of synthetic tweets that resemble those
+  delivered by the Streaming API
+  """
+  filler = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do "
+            "eiusmod tempor incididunt ut labore et dolore magna").split()
+  messages = []
+  for i in xrange(numTweets):
+    tweetSymbols = [
+      rng.choice(symbols) if rng.random() < 0.3
+      else "XYZ%d" % (rng.randint(0, 999),)
+      for _ in xrange(rng.randint(0, 3))]
+    mentionIds = [
+      rng.choice(userIds) if rng.random() < 0.3
+      else str(rng.randint(1, 10**9))
+      for _ in xrange(rng.randint(0, 2))]
+    userId = (rng.choice(userIds) if rng.random() < 0.05
+              else str(rng.randint(1, 10**9)))
+
+    text = " ".join(rng.sample(filler, 10) +
+                    ["$" + symbol for symbol in tweetSymbols])
+    msg = {
+      "created_at": "Wed Aug 05 14:44:32 +0000 2015",
+      "id_str": str(628939652129538049 + i),
+      "in_reply_to_status_id": None,
+      "lang": "en",
+      "text": text,
+      "timestamp_ms": "1438785872858",
+      "user": {"id_str": userId,
+               "screen_name": "user%s" % (userId,),
+               "followers_count": rng.randint(0, 10000),
+               "description": " ".join(rng.sample(filler, 12))},
+      "entities": {
+        "hashtags": [],
+        "symbols": [{"indices": [0, 0], "text": symbol}
+                    for symbol in tweetSymbols],
+        "urls": [],
+        "user_mentions": [{"id_str": mentionId, "indices": [0, 0],
+                           "screen_name": "user%s" % (mentionId,)}
+                          for mentionId in mentionIds]
+      }
+    }
+    messages.append(json.dumps(msg))
+
+    if i % 100 == 99:
+      messages.append(json.dumps({"limit": {"track": i}}))
+
+  return messages
+
+
+
+def _timeIt(name, fn, numMessages):
+  """ Time the given function; reports both the elapsed time and the CPU time
+  of this process, which excludes the work offloaded to tagging workers
+  """
+  start = time.time()
+  cpuStart = time.clock()
+  result = fn()
+  duration = time.time() - start
+  cpuDuration = time.clock() - cpuStart
+  print "%s: %.2fs; %d messages/sec; storer process cpu %.2fs" % (
+    name, duration, numMessages / duration, cpuDuration)
+  return result, duration
+
+
+
+def _parseArgs():
+  parser = OptionParser(usage="%prog [options]\n\n" + __doc__.strip())
+  parser.add_option("--sample",
+                    help="file of recorded raw stream messages, one per line")
+  parser.add_option("--tweets", dest="numTweets", type="int", default=100000,
+                    help="number of synthetic tweets without --sample "
+                         "[default: %default]")
+  parser.add_option("--metrics", dest="numMetrics", type="int", default=500,
+                    help="number of tweet volume metrics [default: %default]")
+  parser.add_option("--workers", dest="numWorkers", type="int", default=4,
+                    help="number of tagging worker processes "
+                         "[default: %default]")
+
+  options, _ = parser.parse_args()
+  return vars(options)
+
+
+
+def main(sample, numTweets, numMetrics, numWorkers):
+  rng = random.Random(42)
+
+  symbols = ["SYM%d" % (i,) for i in xrange(numMetrics)]
+  userIds = [str(10**9 + i) for i in xrange(numMetrics)]
+  metrics = ["TWITTER.TWEET.HANDLE.%s.VOLUME" % (symbol,) for symbol in symbols]
+
+  symbolToMetricMap = dict(
+    (symbol.lower(), metric) for symbol, metric in zip(symbols, metrics))
+  userIdToMetricsMap = dict(
+    (userId, set([metric])) for userId, metric in zip(userIds, metrics))
+  screenNameToMetricsMap = dict(
+    ("user%s" % (userId,), set([metric]))
+    for userId, metric in zip(userIds, metrics))
+
+  if sample:
+    messages = _loadSample(sample)
+  else:
+    messages = _generateSample(numTweets, symbols, userIds, rng)
+  print "Sample stream of %d messages" % (len(messages),)
+
+  formerTaggingMap = {
+    _formerTagOnSymbols: symbolToMetricMap,
+    _formerTagOnSourceUsers: userIdToMetricsMap,
+    _formerTagOnMentions: userIdToMetricsMap,
+  }
+  formerTagSets, formerDuration = _timeIt(
+    "former closures",
+    lambda: _decodeAndTagFormer(formerTaggingMap, messages),
+    len(messages))
+
+  tagger = TweetTagger(symbolToMetricMap=symbolToMetricMap,
+                       userIdToMetricsMap=userIdToMetricsMap,
+                       screenNameToMetricsMap=screenNameToMetricsMap)
+  tagSets, _ = _timeIt(
+    "TweetTagger",
+    lambda: _decodeAndTag(tagger, messages),
+    len(messages))
+  assert tagSets == formerTagSets, "Tags differ"
+
+  textTagger = TweetTagger(symbolToMetricMap=symbolToMetricMap,
+                           userIdToMetricsMap=userIdToMetricsMap,
+                           screenNameToMetricsMap=screenNameToMetricsMap,
+                           tagText=True)
+  textTagSets, _ = _timeIt(
+    "TweetTagger with text",
+    lambda: _decodeAndTag(textTagger, messages),
+    len(messages))
+  assert all(tags <= textTags
+             for tags, textTags in zip(tagSets, textTagSets))
+
+  taggingPool = TweetTaggingPool(numWorkers=numWorkers)
+  taggingPool.start()
+  try:
+    taggingPool.setTagger(tagger)
+    poolTagSets, poolDuration = _timeIt(
+      "TweetTaggingPool with %d workers" % (numWorkers,),
+      lambda: _decodeAndTagInPool(taggingPool, messages),
+      len(messages))
+  finally:
+    taggingPool.terminate()
+  assert poolTagSets == formerTagSets, "Tags differ"
+
+  print "Tagged %d of %d tweets" % (sum(1 for tags in tagSets if tags),
+                                    len(tagSets))
+  print "pool speedup: %.1fx" % (formerDuration / poolDuration,)
+
+
+
+if __name__ == "__main__":
+  main(**_parseArgs())
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Benchmark tweet volume catch-up in the twitter agent's MetricDataForwarder:
+forwarding one aggregation interval at a time, as before, versus chunked
+range queries.
+
+Synthetic twitter_tweet_volume counts are stored in a local SQLite database
+(or the database given by --dsn, e.g. a local MySQL) and published samples are
+counted by a fake message bus.
+"""
+
+from datetime import datetime, timedelta
+from optparse import OptionParser
+import random
+import time
+
+from mock import patch
+import sqlalchemy as sql
+
+from taurus_metric_collectors import metric_utils
+from taurus_metric_collectors.collectorsdb import schema
+from taurus_metric_collectors.twitterdirect import twitter_direct_agent
+
+
+
+class _FakeMessageBus(object):
+  """ Counts messages published by metric_utils.metricDataBatchWrite """
+
+  numMessages = 0
+  samples = []
+
+  def __enter__(self):
+    return self
+
+
+  def __exit__(self, *args):
+    return False
+
+
+  def publish(self, mqName, body, persistent):
+    _FakeMessageBus.numMessages += 1
+    _FakeMessageBus.samples.append(body)
+
+
+
+def _createVolumeTable(dsn, metrics, days, aggSec, maxTweetsPerInterval):
+  """ :returns: engine of a database with a twitter_tweet_volume table filled
+  with synthetic counts
+  """
+  engine = sql.create_engine(dsn)
+  schema.twitterTweetVolume.drop(engine, checkfirst=True)
+  schema.twitterTweetVolume.create(engine)
+
+  rng = random.Random(42)
+  start = datetime(2015, 8, 1)
+  numIntervals = days * 86400 // aggSec
+  rows = []
+  for i in xrange(numIntervals):
+    aggTs = start + timedelta(seconds=aggSec * i)
+    for metric in metrics:
+      numTweets = rng.randint(0, maxTweetsPerInterval)
+      if numTweets:
+        rows.append(dict(agg_ts=aggTs, metric=metric, num_tweets=numTweets))
+
+  for i in xrange(0, len(rows), 10000):
+    engine.execute(schema.twitterTweetVolume.insert(),  # pylint: disable=E1120
+                   rows[i:i + 10000])
+
+  print "Stored %d synthetic tweet volume counts over %d intervals" % (
+    len(rows), numIntervals)
+
+  return engine, start - timedelta(seconds=aggSec), numIntervals
+
+
+
+def _createForwarder(engine, metrics, aggSec):
+  metricSpecs = [
+    twitter_direct_agent.TwitterMetricSpec(resource="Company%d" % (i,),
+                                           metric=metric,
+                                           screenNames=[],
+                                           symbol="SYM%d" % (i,))
+    for i, metric in enumerate(metrics)
+  ]
+  with patch.object(twitter_direct_agent.collectorsdb, "engineFactory",
+                    return_value=engine):
+    return twitter_direct_agent.MetricDataForwarder(metricSpecs=metricSpecs,
+                                                    aggSec=aggSec)
+
+
+
+def _forwardPerInterval(forwarder, lastEmittedAggTime, stopDatetime):
+  """ The former forwarding loop: one query, one publishing session and one
+  watermark update per aggregation interval
+  """
+  periodTimedelta = timedelta(seconds=forwarder._aggSec)
+  aggStartDatetime = lastEmittedAggTime + periodTimedelta
+  while aggStartDatetime < stopDatetime:
+    forwarder.aggregateAndForward(
+      aggStartDatetime=aggStartDatetime,
+      stopDatetime=aggStartDatetime + periodTimedelta)
+    metric_utils.updateLastEmittedSampleDatetime(
+      key=twitter_direct_agent._EMITTED_TWEET_VOLUME_SAMPLE_TRACKER_KEY,
+      sampleDatetime=aggStartDatetime)
+    lastEmittedAggTime = aggStartDatetime
+    aggStartDatetime += periodTimedelta
+
+  return lastEmittedAggTime
+
+
+
+def _timeForwarding(name, forwardFn, forwarder, lastEmittedAggTime,
+                    stopDatetime):
+  _FakeMessageBus.numMessages = 0
+  _FakeMessageBus.samples = []
+  watermarkUpdates = []
+
+  with patch.object(metric_utils.message_bus_connector,
+                    "MessageBusConnector", _FakeMessageBus), \
+      patch.object(metric_utils, "updateLastEmittedSampleDatetime",
+                   side_effect=lambda key, sampleDatetime:
+                   watermarkUpdates.append(sampleDatetime)):
+    start = time.time()
+    result = forwardFn(forwarder, lastEmittedAggTime, stopDatetime)
+    duration = time.time() - start
+
+  print ("%s: %.2fs; published %d messages; %d watermark updates; last=%s" %
+         (name, duration, _FakeMessageBus.numMessages, len(watermarkUpdates),
+          result))
+
+  samples = []
+  for body in _FakeMessageBus.samples:
+    samples.extend(twitter_direct_agent.json.loads(body)["data"])
+
+  return duration, result, samples
+
+
+
+def _parseArgs():
+  parser = OptionParser(usage="%prog [options]\n\n" + __doc__.strip())
+  parser.add_option("--dsn", default="sqlite://",
+                    help="SQLAlchemy URL of the scratch database "
+                         "[default: %default]")
+  parser.add_option("--days", type="int", default=7,
+                    help="days of tweet samples [default: %default]")
+  parser.add_option("--metrics", dest="numMetrics", type="int", default=50,
+                    help="number of tweet volume metrics [default: %default]")
+  parser.add_option("--max-tweets", dest="maxTweetsPerInterval", type="int",
+                    default=4,
+                    help="maximum tweets per metric per interval "
+                         "[default: %default]")
+
+  options, _ = parser.parse_args()
+  return vars(options)
+
+
+
+def main(dsn, days, numMetrics, maxTweetsPerInterval):
+  aggSec = 300
+  metrics = ["TWITTER.TWEET.HANDLE.SYM%d.VOLUME" % (i,)
+             for i in xrange(numMetrics)]
+
+  engine, lastEmittedAggTime, numIntervals = _createVolumeTable(
+    dsn, metrics, days, aggSec, maxTweetsPerInterval)
+  stopDatetime = lastEmittedAggTime + timedelta(seconds=aggSec *
+                                                (numIntervals + 1))
+
+  forwarder = _createForwarder(engine, metrics, aggSec)
+
+  perIntervalDuration, perIntervalResult, perIntervalSamples = (
+    _timeForwarding("per interval", _forwardPerInterval, forwarder,
+                    lastEmittedAggTime, stopDatetime))
+
+  # pylint: disable=W0212
+  catchUpDuration, catchUpResult, catchUpSamples = _timeForwarding(
+    "catch-up",
+    lambda forwarder, lastEmittedAggTime, stopDatetime:
+      forwarder._forwardTweetVolumeMetrics(lastEmittedAggTime, stopDatetime),
+    forwarder, lastEmittedAggTime, stopDatetime)
+
+  print "speedup: %.1fx" % (perIntervalDuration / catchUpDuration,)
+
+  assert catchUpResult == perIntervalResult
+  assert catchUpSamples == perIntervalSamples, "Forwarded samples differ"
+
+
+
+if __name__ == "__main__":
+  main(**_parseArgs())
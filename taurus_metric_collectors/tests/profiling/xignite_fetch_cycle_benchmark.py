@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Benchmark one polling cycle of the xignite stock agent over many symbols,
+offline: the former poll() and per-symbol forward() in a worker pool versus
+XigniteFetchScheduler with _saveNewBars().
+
+XIgnite is replaced by a local fake GetBars HTTP server with configurable
+response latency, and the bars are saved to a scratch SQLite database (or the
+database given by --dsn, e.g. a local MySQL). Forwarding to Taurus is
+disabled in both cases.
+"""
+
+import BaseHTTPServer
+import datetime
+import json
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from optparse import OptionParser
+import os
+import shutil
+import SocketServer
+import tempfile
+import threading
+import time
+import urlparse
+
+from mock import patch
+import sqlalchemy as sql
+
+from taurus_metric_collectors import ApplicationConfig
+from taurus_metric_collectors.collectorsdb import schema
+from taurus_metric_collectors.xignite import xignite_stock_agent
+from taurus_metric_collectors.xignite.xignite_fetch_scheduler import (
+  XigniteFetchScheduler)
+
+
+
+class _FakeXigniteHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """ Serves XigniteGlobalQuotes GetBars responses of the server's
+  `numBars` 5-minute bars starting at market open
+  """
+
+  # Keep connections alive for clients that reuse them
+  protocol_version = "HTTP/1.1"
+
+
+  def do_GET(self):  # pylint: disable=C0103
+    query = dict(urlparse.parse_qsl(urlparse.urlparse(self.path).query))
+    symbol = query["Identifier"]
+
+    time.sleep(self.server.latencySec)
+
+    marketOpen = datetime.datetime(2015, 1, 15, 9, 30)
+    bars = []
+    for i in xrange(self.server.numBars):
+      start = marketOpen + datetime.timedelta(minutes=5 * i)
+      end = start + datetime.timedelta(minutes=5)
+      bars.append({"StartDate": "1/15/2015",
+                   "StartTime": start.strftime("%I:%M:%S %p"),
+                   "EndDate": "1/15/2015",
+                   "EndTime": end.strftime("%I:%M:%S %p"),
+                   "UTCOffset": -5,
+                   "Open": 46.225,
+                   "High": 46.38,
+                   "Low": 45.955,
+                   "Close": 45.96,
+                   "Volume": 504494 + i,
+                   "Trades": 2414})
+
+    body = json.dumps({
+      "Outcome": "Success",
+      "Message": None,
+      "Identity": "Request",
+      "Delay": 0.0,
+      "Security": {"Symbol": symbol,
+                   "CIK": None,
+                   "CUSIP": None,
+                   "ISIN": None,
+                   "Valoren": None,
+                   "Name": "%s Inc." % (symbol,),
+                   "Market": "NASDAQ",
+                   "MarketIdentificationCode": "XNAS",
+                   "MostLiquidExchange": True,
+                   "CategoryOrIndustry": None},
+      "Bars": bars
+    })
+
+    self.send_response(200)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+
+  def log_message(self, *args):  # pylint: disable=W0221
+    pass
+
+
+
+class _FakeXigniteServer(SocketServer.ThreadingMixIn,
+                         BaseHTTPServer.HTTPServer):
+  """ Threaded fake XIgnite server on an ephemeral local port; counts the
+  accepted connections
+  """
+
+  daemon_threads = True
+  request_queue_size = 128
+
+
+  def __init__(self, latencySec, numBars):
+    BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0),
+                                       _FakeXigniteHandler)
+    self.latencySec = latencySec
+    self.numBars = numBars
+    self.numConnections = 0
+
+
+  def get_request(self):
+    request = BaseHTTPServer.HTTPServer.get_request(self)
+    self.numConnections += 1
+    return request
+
+
+  @property
+  def apiUrl(self):
+    return "http://127.0.0.1:%d/GetBars?" % (self.server_address[1],)
+
+
+
+def _createDatabase(dsn):
+  """ :returns: engine of a database with empty xignite tables """
+  if not dsn.startswith("sqlite"):
+    engine = sql.create_engine(dsn)
+  else:
+    engine = sql.create_engine(dsn, connect_args={"timeout": 60})
+
+    # Stand-in for the MySQL collation of xignite_security columns
+    sql.event.listen(
+      engine, "connect",
+      lambda dbapiConnection, _: dbapiConnection.create_collation(
+        "latin1_swedish_ci", lambda a, b: cmp(a.lower(), b.lower())))
+
+  tables = [schema.xigniteSecurity, schema.xigniteSecurityBars,
+            schema.emittedStockPrice, schema.emittedStockVolume]
+  schema.metadata.drop_all(engine, tables=tables, checkfirst=True)
+  schema.metadata.create_all(engine, tables=tables)
+  return engine
+
+
+
+def _runFormerCycle(symbolToMetricSpecs, numWorkers):
+  """ The former polling cycle: poll() and forward() of each symbol in a
+  worker pool, with a new connection per request and a transaction per bar
+  """
+  pool = ThreadPool(processes=numWorkers)
+  try:
+    pendingAsyncResults = []
+    for security, data in pool.imap_unordered(
+        lambda metricSpecs: xignite_stock_agent.poll(metricSpecs,
+                                                     apitoken="apitoken",
+                                                     barlength=5,
+                                                     days=1),
+        symbolToMetricSpecs.itervalues()):
+      if data:
+        pendingAsyncResults.append(
+          pool.apply_async(
+            xignite_stock_agent.forward,
+            (symbolToMetricSpecs[security["Symbol"]], data, security)))
+
+    for asyncResult in pendingAsyncResults:
+      asyncResult.get()
+  finally:
+    pool.terminate()
+    pool.join()
+
+
+
+def _runSchedulerCycle(symbolToMetricSpecs, numThreads, maxRequestsPerSec):
+  scheduler = XigniteFetchScheduler(numThreads=numThreads,
+                                    maxRequestsPerSec=maxRequestsPerSec,
+                                    initialBackoffSec=300,
+                                    maxBackoffSec=3600)
+  try:
+    # pylint: disable=W0212
+    xignite_stock_agent._runPollingCycle(
+      scheduler=scheduler,
+      pollFn=lambda metricSpecs, httpSession, rateLimit:
+        xignite_stock_agent._pollWithSession(metricSpecs,
+                                             httpSession=httpSession,
+                                             rateLimit=rateLimit,
+                                             apitoken="apitoken",
+                                             barlength=5,
+                                             days=1),
+      symbolToMetricSpecs=symbolToMetricSpecs)
+  finally:
+    scheduler.close()
+
+
+
+def _timeCycle(name, cycleFn, dsn, server):
+  engine = _createDatabase(dsn)
+  server.numConnections = 0
+
+  with patch.object(xignite_stock_agent.collectorsdb, "engineFactory",
+                    return_value=engine), \
+      patch.object(xignite_stock_agent, "_purgeOldRecords"):
+    start = time.time()
+    cycleFn()
+    duration = time.time() - start
+
+  numBars = engine.execute(
+    sql.select([sql.func.count()]).select_from(schema.xigniteSecurityBars)
+  ).scalar()
+
+  print "%s: %.2fs; %d http connections; saved %d bars" % (
+    name, duration, server.numConnections, numBars)
+
+  engine.dispose()
+  return duration, numBars
+
+
+
+def _parseArgs():
+  parser = OptionParser(usage="%prog [options]\n\n" + __doc__.strip())
+  parser.add_option("--dsn",
+                    help="SQLAlchemy URL of the scratch database [default: a "
+                         "temporary SQLite file]")
+  parser.add_option("--symbols", dest="numSymbols", type="int", default=500,
+                    help="number of stock symbols [default: %default]")
+  parser.add_option("--bars", dest="numBars", type="int", default=12,
+                    help="new bars per symbol [default: %default]")
+  parser.add_option("--latency-ms", dest="latencyMs", type="int", default=50,
+                    help="fake XIgnite response latency [default: %default]")
+  parser.add_option("--former-workers", dest="numFormerWorkers", type="int",
+                    default=cpu_count(),
+                    help="former worker pool size, which defaulted to the "
+                         "number of CPUs [default: %default]")
+  parser.add_option("--fetch-threads", dest="numThreads", type="int",
+                    default=xignite_stock_agent.DEFAULT_FETCH_THREADS,
+                    help="scheduler fetch threads [default: %default]")
+  parser.add_option("--max-requests-per-sec", dest="maxRequestsPerSec",
+                    type="float", default=1000,
+                    help="scheduler rate limit [default: %default]")
+
+  options, _ = parser.parse_args()
+  return vars(options)
+
+
+
+def main(dsn, numSymbols, numBars, latencyMs, numFormerWorkers, numThreads,
+         maxRequestsPerSec):
+  server = _FakeXigniteServer(latencySec=latencyMs / 1000.0, numBars=numBars)
+  serverThread = threading.Thread(target=server.serve_forever)
+  serverThread.setDaemon(True)
+  serverThread.start()
+
+  tempDir = None
+  if dsn is None:
+    tempDir = tempfile.mkdtemp()
+    dsn = "sqlite:///%s" % (os.path.join(tempDir, "collectors.db"),)
+
+  symbolToMetricSpecs = dict(
+    (symbol, [xignite_stock_agent.StockMetricSpec(
+      metricName="XIGNITE.%s.VOLUME" % (symbol,),
+      symbol=symbol,
+      stockExchange="NASDAQ",
+      sampleKey="Volume")])
+    for symbol in ("SYM%d" % (i,) for i in xrange(numSymbols)))
+
+  print "Polling %d symbols; %d bars each; %dms latency" % (
+    numSymbols, numBars, latencyMs)
+
+  try:
+    with patch.object(xignite_stock_agent, "_API_URL", server.apiUrl), \
+        patch.object(xignite_stock_agent, "g_opMode",
+                     ApplicationConfig.OP_MODE_HOT_STANDBY), \
+        patch.object(xignite_stock_agent, "HISTORY_PATH",
+                     tempDir or tempfile.gettempdir()):
+      formerDuration, formerNumBars = _timeCycle(
+        "former pool of %d workers" % (numFormerWorkers,),
+        lambda: _runFormerCycle(symbolToMetricSpecs, numFormerWorkers),
+        dsn, server)
+
+      schedulerDuration, schedulerNumBars = _timeCycle(
+        "scheduler with %d threads" % (numThreads,),
+        lambda: _runSchedulerCycle(symbolToMetricSpecs, numThreads,
+                                   maxRequestsPerSec),
+        dsn, server)
+  finally:
+    server.shutdown()
+    if tempDir is not None:
+      shutil.rmtree(tempDir)
+
+  assert schedulerNumBars == formerNumBars, "Saved bars differ"
+
+  print "speedup: %.1fx" % (formerDuration / schedulerDuration,)
+
+
+
+if __name__ == "__main__":
+  main(**_parseArgs())
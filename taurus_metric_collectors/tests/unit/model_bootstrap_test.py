@@ -0,0 +1,252 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+unit tests for taurus_metric_collectors.model_bootstrap against a local stub
+of the Taurus _models API
+"""
+
+import BaseHTTPServer
+import json
+import os
+import shutil
+import SocketServer
+import tempfile
+import threading
+import unittest
+
+from taurus_metric_collectors import logging_support, metric_utils
+from taurus_metric_collectors.model_bootstrap import (loadResumeFile,
+                                                      ModelBootstrapper)
+
+
+
+def setUpModule():
+  logging_support.LoggingSupport.initTestApp()
+
+
+
+class _StubModelsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """ Handles _models POST requests like the Taurus API """
+
+  protocol_version = "HTTP/1.1"
+
+
+  def do_POST(self):  # pylint: disable=C0103
+    server = self.server
+    payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+    specs = payload if isinstance(payload, list) else [payload]
+
+    with server.lock:
+      server.requests.append([spec["metricSpec"]["metric"] for spec in specs])
+
+      if server.numTransientFailures > 0:
+        server.numTransientFailures -= 1
+        self._respond(503, "Service Unavailable")
+        return
+
+      if any(spec["metricSpec"]["metric"] in server.invalidMetricNames
+             for spec in specs):
+        self._respond(400, "Invalid model spec")
+        return
+
+      if len(server.models) + len(specs) > server.quota:
+        self._respond(500, "Server limit exceeded")
+        return
+
+      result = []
+      for spec in specs:
+        metricName = spec["metricSpec"]["metric"]
+        model = server.models.setdefault(
+          metricName, {"name": metricName, "uid": "uid-" + metricName})
+        result.append(model)
+
+    self._respond(201, json.dumps(result))
+
+
+  def _respond(self, status, body):
+    self.send_response(status)
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+
+  def log_message(self, *args):  # pylint: disable=W0221
+    pass
+
+
+
+class _StubModelsServer(SocketServer.ThreadingMixIn,
+                        BaseHTTPServer.HTTPServer):
+
+  daemon_threads = True
+
+
+  def __init__(self):
+    BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0),
+                                       _StubModelsHandler)
+    self.lock = threading.Lock()
+    self.requests = []
+    self.models = {}
+    self.invalidMetricNames = set()
+    self.numTransientFailures = 0
+    self.quota = float("inf")
+
+
+  @property
+  def baseUrl(self):
+    return "http://127.0.0.1:%d" % (self.server_address[1],)
+
+
+
+def _createModelSpecs(numMetrics):
+  return [
+    metric_utils.createCustomModelSpec(
+      metricName="XIGNITE.SYM%d.VOLUME" % (i,),
+      resourceName="Company %d" % (i,),
+      userInfo={"metricType": "StockVolume",
+                "metricTypeName": "Stock Volume",
+                "symbol": "SYM%d" % (i,)},
+      modelParams={})
+    for i in xrange(numMetrics)]
+
+
+
+class ModelBootstrapperTestCase(unittest.TestCase):
+
+  def setUp(self):
+    self.server = _StubModelsServer()
+    serverThread = threading.Thread(target=self.server.serve_forever)
+    serverThread.setDaemon(True)
+    serverThread.start()
+    self.addCleanup(self.server.server_close)
+    self.addCleanup(self.server.shutdown)
+
+    tempDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tempDir)
+    self.resumePath = os.path.join(tempDir, "resume.json")
+
+
+  def _createBootstrapper(self, **kwargs):
+    params = dict(baseUrl=self.server.baseUrl,
+                  apiKey="apikey",
+                  concurrency=4,
+                  resumePath=self.resumePath,
+                  initialRetryDelaySec=0.01,
+                  maxRetryDelaySec=0.01)
+    params.update(kwargs)
+    return ModelBootstrapper(**params)
+
+
+  def testCreateModelsConcurrently(self):
+    modelSpecs = _createModelSpecs(20)
+
+    result = self._createBootstrapper().run(modelSpecs)
+
+    self.assertEqual(result.numCreated, 20)
+    self.assertEqual(result.numSkipped, 0)
+    self.assertEqual(result.failedMetricNames, [])
+    self.assertEqual(len(self.server.requests), 20)
+    self.assertItemsEqual(self.server.models,
+                          [spec["metricSpec"]["metric"] for spec in modelSpecs])
+
+    # All created models are in the resume file
+    self.assertEqual(loadResumeFile(self.resumePath), set(self.server.models))
+
+
+  def testBulkCreate(self):
+    result = self._createBootstrapper(bulkSize=8).run(_createModelSpecs(20))
+
+    self.assertEqual(result.numCreated, 20)
+    self.assertItemsEqual([len(names) for names in self.server.requests],
+                          [8, 8, 4])
+
+
+  def testResumeSkipsCreatedModels(self):
+    modelSpecs = _createModelSpecs(10)
+    createdNames = [spec["metricSpec"]["metric"] for spec in modelSpecs[:6]]
+
+    with open(self.resumePath, "w") as fileObj:
+      for name in createdNames:
+        fileObj.write(json.dumps({"metric": name, "uid": "x"}) + "\n")
+      # Truncated by a crash mid-write
+      fileObj.write('{"metric": "XIGN')
+
+    result = self._createBootstrapper().run(modelSpecs)
+
+    self.assertEqual(result.numCreated, 4)
+    self.assertEqual(result.numSkipped, 6)
+    self.assertFalse(set(createdNames) & set(self.server.models))
+    self.assertEqual(loadResumeFile(self.resumePath),
+                     set(spec["metricSpec"]["metric"] for spec in modelSpecs))
+
+
+  def testRejectedBulkFallsBackToSingleModels(self):
+    modelSpecs = _createModelSpecs(6)
+    invalidName = modelSpecs[2]["metricSpec"]["metric"]
+    self.server.invalidMetricNames.add(invalidName)
+
+    result = self._createBootstrapper(bulkSize=3).run(modelSpecs)
+
+    self.assertEqual(result.numCreated, 5)
+    self.assertEqual(result.failedMetricNames, [invalidName])
+    self.assertNotIn(invalidName, self.server.models)
+    self.assertNotIn(invalidName, loadResumeFile(self.resumePath))
+
+
+  def testTransientErrorsAreRetried(self):
+    self.server.numTransientFailures = 3
+
+    result = self._createBootstrapper(concurrency=1).run(_createModelSpecs(2))
+
+    self.assertEqual(result.numCreated, 2)
+    self.assertEqual(result.failedMetricNames, [])
+    self.assertEqual(len(self.server.requests), 5)
+
+
+  def testRetriesExceeded(self):
+    self.server.numTransientFailures = 100
+
+    result = self._createBootstrapper(concurrency=1, maxAttempts=3).run(
+      _createModelSpecs(1))
+
+    self.assertEqual(result.numCreated, 0)
+    self.assertEqual(result.failedMetricNames,
+                     ["XIGNITE.SYM0.VOLUME"])
+    self.assertEqual(len(self.server.requests), 3)
+
+
+  def testQuotaExceededAborts(self):
+    self.server.quota = 5
+
+    bootstrapper = self._createBootstrapper(concurrency=2)
+    with self.assertRaises(metric_utils.ModelQuotaExceededError):
+      bootstrapper.run(_createModelSpecs(50))
+
+    self.assertEqual(len(self.server.models), 5)
+    # Remaining specs are not attempted once quota is exceeded
+    self.assertLess(len(self.server.requests), 50)
+    self.assertEqual(loadResumeFile(self.resumePath), set(self.server.models))
+
+
+
+if __name__ == "__main__":
+  unittest.main()
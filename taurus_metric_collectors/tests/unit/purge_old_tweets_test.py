@@ -171,5 +171,44 @@ class PurgeOldTweetsUnitTestCase(unittest.TestCase):
 
 
 
+
+@patch("taurus_metric_collectors.twitterdirect.purge_old_tweets"
+       "._deleteOldTweetVolumeCounts", autospec=True)
+@patch("taurus_metric_collectors.twitterdirect.purge_old_tweets"
+       ".collectorsdb",
+       new=mock.Mock(spec_set=taurus_metric_collectors.collectorsdb))
+class PurgeOldTweetVolumeCountsUnitTestCase(unittest.TestCase):
+
+
+  def testPurgeOldTweetVolumeCountsInBatches(self,
+                                             deleteOldTweetVolumeCountsMock):
+    deletedCounts = [
+      purge_old_tweets._MAX_DELETE_BATCH_SIZE,
+      purge_old_tweets._MAX_DELETE_BATCH_SIZE,
+      7
+    ]
+    deleteOldTweetVolumeCountsMock.side_effect = iter(deletedCounts)
+
+    numDeleted = purge_old_tweets.purgeOldTweetVolumeCounts(thresholdDays=90)
+
+    self.assertEqual(numDeleted, sum(deletedCounts))
+    self.assertEqual(deleteOldTweetVolumeCountsMock.call_count, 3)
+    for _, kwargs in deleteOldTweetVolumeCountsMock.call_args_list:
+      self.assertEqual(kwargs["thresholdDays"], 90)
+      self.assertEqual(kwargs["limit"],
+                       purge_old_tweets._MAX_DELETE_BATCH_SIZE)
+
+
+  def testPurgeOldTweetVolumeCountsWithoutOldRecords(
+      self, deleteOldTweetVolumeCountsMock):
+    deleteOldTweetVolumeCountsMock.return_value = 0
+
+    numDeleted = purge_old_tweets.purgeOldTweetVolumeCounts(thresholdDays=90)
+
+    self.assertEqual(numDeleted, 0)
+    self.assertEqual(deleteOldTweetVolumeCountsMock.call_count, 1)
+
+
+
 if __name__ == "__main__":
   unittest.main()
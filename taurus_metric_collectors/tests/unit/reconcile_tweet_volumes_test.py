@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""Unit test for taurus_metric_collectors.twitterdirect.reconcile_tweet_volumes
+"""
+
+# Suppress pylint warnings concerning access to protected member
+# pylint: disable=W0212
+
+
+from datetime import datetime, timedelta
+import unittest
+
+from mock import patch
+import sqlalchemy as sql
+
+from taurus_metric_collectors import logging_support
+from taurus_metric_collectors.collectorsdb import schema
+from taurus_metric_collectors.twitterdirect import reconcile_tweet_volumes
+from taurus_metric_collectors.twitterdirect.reconcile_tweet_volumes import (
+  TweetVolumeMismatch)
+
+
+
+def setUpModule():
+  logging_support.LoggingSupport.initTestApp()
+
+
+
+@patch("taurus_metric_collectors.twitterdirect.reconcile_tweet_volumes"
+       "._setTweetVolumeCounts", autospec=True)
+@patch("taurus_metric_collectors.twitterdirect.reconcile_tweet_volumes"
+       ".collectorsdb.engineFactory", autospec=True)
+class ReconcileTweetVolumesUnitTestCase(unittest.TestCase):
+
+  def setUp(self):
+    # In-memory stand-in for the collectors database
+    self.engine = sql.create_engine("sqlite://")
+    schema.twitterTweetSamples.create(self.engine)
+    schema.twitterTweetVolume.create(self.engine)
+
+    self.agg1 = datetime(2015, 8, 5, 14, 40)
+    self.agg2 = self.agg1 + timedelta(seconds=300)
+
+    samples = [("A", self.agg1)] * 3 + [("B", self.agg1)] + [("A", self.agg2)]
+    self.engine.execute(
+      schema.twitterTweetSamples.insert(),  # pylint: disable=E1120
+      [dict(seq=seq, metric=metric, msg_uid=str(seq), agg_ts=aggTs)
+       for seq, (metric, aggTs) in enumerate(samples, 1)])
+
+
+  def _storeCounts(self, counts):
+    self.engine.execute(
+      schema.twitterTweetVolume.insert(),  # pylint: disable=E1120
+      [dict(agg_ts=aggTs, metric=metric, num_tweets=numTweets)
+       for aggTs, metric, numTweets in counts])
+
+
+  def testNoMismatches(self, engineFactoryMock, setTweetVolumeCountsMock):
+    engineFactoryMock.return_value = self.engine
+    self._storeCounts([(self.agg1, "A", 3), (self.agg1, "B", 1),
+                       (self.agg2, "A", 1)])
+
+    mismatches = reconcile_tweet_volumes.reconcileTweetVolumes(
+      startDatetime=datetime(2015, 8, 4),
+      stopDatetime=datetime(2015, 8, 6),
+      fix=True)
+
+    self.assertEqual(mismatches, [])
+    self.assertFalse(setTweetVolumeCountsMock.called)
+
+
+  def testMismatchesAreReportedAndFixed(self, engineFactoryMock,
+                                        setTweetVolumeCountsMock):
+    engineFactoryMock.return_value = self.engine
+    # agg1/A undercounted, agg1/B missing, agg2/B has no samples
+    self._storeCounts([(self.agg1, "A", 2), (self.agg2, "A", 1),
+                       (self.agg2, "B", 4)])
+
+    expected = [
+      TweetVolumeMismatch(aggTs=self.agg1, metric="A", numSamples=3,
+                          numCounted=2),
+      TweetVolumeMismatch(aggTs=self.agg1, metric="B", numSamples=1,
+                          numCounted=0),
+      TweetVolumeMismatch(aggTs=self.agg2, metric="B", numSamples=0,
+                          numCounted=4),
+    ]
+
+    mismatches = reconcile_tweet_volumes.reconcileTweetVolumes(
+      startDatetime=datetime(2015, 8, 4),
+      stopDatetime=datetime(2015, 8, 6),
+      fix=True)
+
+    self.assertEqual(mismatches, expected)
+    setTweetVolumeCountsMock.assert_called_once_with(self.engine, expected)
+
+
+  def testVerifiesOnlyGivenRange(self, engineFactoryMock,
+                                 setTweetVolumeCountsMock):
+    engineFactoryMock.return_value = self.engine
+
+    mismatches = reconcile_tweet_volumes.reconcileTweetVolumes(
+      startDatetime=self.agg2,
+      stopDatetime=self.agg2 + timedelta(seconds=300),
+      fix=False)
+
+    self.assertEqual(mismatches, [
+      TweetVolumeMismatch(aggTs=self.agg2, metric="A", numSamples=1,
+                          numCounted=0)])
+    self.assertFalse(setTweetVolumeCountsMock.called)
+
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+unit tests for taurus_metric_collectors.twitterdirect.tweet_tagging
+"""
+
+import cPickle
+import json
+import Queue
+import threading
+import unittest
+
+from taurus_metric_collectors import logging_support
+from taurus_metric_collectors.twitterdirect import tweet_tagging
+from taurus_metric_collectors.twitterdirect.tweet_tagging import (
+  decodeAndTagMessages,
+  TweetTagger,
+  TweetTaggingPool)
+
+
+
+def setUpModule():
+  logging_support.LoggingSupport.initTestApp()
+
+
+
+_ACN = "TWITTER.TWEET.HANDLE.ACN.VOLUME"
+_BRKB = "TWITTER.TWEET.HANDLE.BRK.B.VOLUME"
+_GOOG = "TWITTER.TWEET.HANDLE.GOOG.VOLUME"
+_GOOGL = "TWITTER.TWEET.HANDLE.GOOGL.VOLUME"
+
+
+
+def _createTagger(tagText=False):
+  return TweetTagger(
+    symbolToMetricMap={"acn": _ACN, "brk.b": _BRKB, "goog": _GOOG,
+                       "googl": _GOOGL},
+    userIdToMetricsMap={"10194682": set([_ACN]),
+                        "20536157": set([_GOOG, _GOOGL])},
+    screenNameToMetricsMap={"accenture": set([_ACN]),
+                            "google": set([_GOOG, _GOOGL])},
+    tagText=tagText)
+
+
+
+def _createTweet(text="", userId="1", symbols=(), mentionIds=()):
+  return {
+    "in_reply_to_status_id": None,
+    "text": text,
+    "user": {"id_str": userId},
+    "entities": {
+      "symbols": [{"text": symbol} for symbol in symbols],
+      "user_mentions": [{"id_str": mentionId} for mentionId in mentionIds]
+    }
+  }
+
+
+
+class TweetTaggerTestCase(unittest.TestCase):
+
+  def testTagOnEntitiesAndSourceUser(self):
+    tagger = _createTagger()
+
+    msg = _createTweet(symbols=["ACN", "XYZ"])
+    self.assertEqual(tagger.tag(msg), set([_ACN]))
+    self.assertEqual(msg["metricTagSet"], set([_ACN]))
+
+    self.assertEqual(tagger.tag(_createTweet(mentionIds=["20536157"])),
+                     set([_GOOG, _GOOGL]))
+
+    self.assertEqual(tagger.tag(_createTweet(userId="10194682",
+                                             symbols=["BRK.B"])),
+                     set([_ACN, _BRKB]))
+
+
+  def testNoTags(self):
+    tagger = _createTagger()
+
+    self.assertEqual(tagger.tag(_createTweet(text="$ACN @google")), set())
+
+    msg = {"in_reply_to_status_id": None}
+    self.assertEqual(tagger.tag(msg), set())
+    self.assertEqual(msg["metricTagSet"], set())
+
+    msg = _createTweet()
+    msg["entities"]["symbols"] = None
+    msg["user"] = None
+    self.assertEqual(tagger.tag(msg), set())
+
+
+  def testTagOnText(self):
+    tagger = _createTagger(tagText=True)
+
+    self.assertEqual(tagger.tag(_createTweet(text="Buying $ACN from @Google")),
+                     set([_ACN, _GOOG, _GOOGL]))
+
+    self.assertEqual(tagger.tag(_createTweet(text="$brk.b and $goog.")),
+                     set([_BRKB, _GOOG]))
+
+    # Not cashtags or mentions
+    self.assertEqual(
+      tagger.tag(_createTweet(text="me@google.com $$ACN $acnx $100")),
+      set())
+
+    msg = _createTweet(text="truncated...")
+    msg["extended_tweet"] = {"full_text": "truncated... $GOOGL"}
+    self.assertEqual(tagger.tag(msg), set([_GOOGL]))
+
+
+  def testPicklable(self):
+    tagger = cPickle.loads(cPickle.dumps(_createTagger(tagText=True),
+                                         cPickle.HIGHEST_PROTOCOL))
+
+    self.assertEqual(tagger.tag(_createTweet(text="@accenture",
+                                             symbols=["GOOG"])),
+                     set([_ACN, _GOOG]))
+
+
+
+class DecodeAndTagMessagesTestCase(unittest.TestCase):
+
+  def testDecodeAndTagMessages(self):
+    taggedTweet = _createTweet(symbols=["ACN"])
+    delete = {"delete": {"status": {"id_str": "123"}}}
+
+    results = decodeAndTagMessages(
+      _createTagger(),
+      [json.dumps(taggedTweet),
+       json.dumps(_createTweet(text="untagged")),
+       json.dumps(delete),
+       '{"in_reply_to_status_id": nu'])
+
+    taggedTweet["metricTagSet"] = set([_ACN])
+    self.assertEqual(results, [
+      taggedTweet,
+      # Untagged tweets are reduced
+      {"in_reply_to_status_id": None, "metricTagSet": set()},
+      delete,
+      # Messages that fail to decode are passed through as is
+      '{"in_reply_to_status_id": nu'])
+
+
+
+class TweetTaggingPoolTestCase(unittest.TestCase):
+
+  def testMessagesAreDecodedAndTaggedInOrder(self):
+    taggingPool = TweetTaggingPool(numWorkers=2)
+    taggingPool.start()
+    self.addCleanup(taggingPool.terminate)
+    self.assertTrue(taggingPool.isAlive())
+
+    taggingPool.setTagger(_createTagger())
+
+    class Marker(object):
+      pass
+
+    messages = [Marker]
+    expected = [Marker]
+    for i in xrange(250):
+      msg = _createTweet(text=str(i), symbols=["ACN"] if i % 2 else [])
+      messages.append(json.dumps(msg))
+      if i % 2:
+        msg["metricTagSet"] = set([_ACN])
+      else:
+        msg = {"in_reply_to_status_id": None, "metricTagSet": set()}
+      expected.append(msg)
+
+      if i == 100:
+        messages.append(Marker)
+        expected.append(Marker)
+
+    # Feed in batches of various sizes
+    taggingPool.submit(messages[:7])
+    taggingPool.submit(messages[7:])
+
+    results = [taggingPool.get(timeout=10) for _ in xrange(len(expected))]
+    self.assertEqual(results, expected)
+
+    with self.assertRaises(Queue.Empty):
+      taggingPool.get(timeout=0.1)
+
+
+  def testRunFeeder(self):
+    taggingPool = TweetTaggingPool(numWorkers=1)
+    taggingPool.start()
+    self.addCleanup(taggingPool.terminate)
+
+    taggingPool.setTagger(_createTagger())
+
+    msgQ = Queue.Queue()
+    for i in xrange(tweet_tagging.TweetTaggingPool._MAX_BATCH_SIZE + 1):
+      msgQ.put(json.dumps(_createTweet(text=str(i), mentionIds=["10194682"])))
+
+    feederThread = threading.Thread(target=taggingPool.runFeeder,
+                                    kwargs=dict(msgQ=msgQ))
+    feederThread.setDaemon(True)
+    feederThread.start()
+
+    for i in xrange(tweet_tagging.TweetTaggingPool._MAX_BATCH_SIZE + 1):
+      msg = taggingPool.get(timeout=10)
+      self.assertEqual(msg["text"], str(i))
+      self.assertEqual(msg["metricTagSet"], set([_ACN]))
+
+
+
+if __name__ == "__main__":
+  unittest.main()
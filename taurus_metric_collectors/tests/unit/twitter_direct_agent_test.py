@@ -24,11 +24,11 @@
 unit tests for taurus_metric_collectors.twitterdirect.twitter_direct_agent
 """
 
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 import unittest
 
-from mock import Mock
+from mock import Mock, patch
 
 from taurus_metric_collectors.twitterdirect import twitter_direct_agent
 
@@ -83,7 +83,7 @@ class TweetStorerTestCase(unittest.TestCase):
     """ Test handling of empty message sequence by TweetStorer._reapMessages
     """
     storer = twitter_direct_agent.TweetStorer(
-      taggingMap=Mock(),
+      tagger=Mock(),
       aggSec=300,
       msgQ=Mock(),
       echoData=False)
@@ -98,7 +98,7 @@ class TweetStorerTestCase(unittest.TestCase):
     """ Test handling of "limit" notifications in TweetStorer._reapMessages
     """
     storer = twitter_direct_agent.TweetStorer(
-      taggingMap=Mock(),
+      tagger=Mock(),
       aggSec=300,
       msgQ=Mock(),
       echoData=False)
@@ -170,7 +170,7 @@ class TweetStorerTestCase(unittest.TestCase):
     `twitter_tweets` table with null values, causing the agent to crash later
     in the pipeline """
     storer = twitter_direct_agent.TweetStorer(
-      taggingMap=Mock(),
+      tagger=Mock(),
       aggSec=300,
       msgQ=Mock(),
       echoData=False)
@@ -262,5 +262,213 @@ class TweetStorerTestCase(unittest.TestCase):
     self.assertEqual(tweetRow["created_at"], datetime(2015, 8, 5, 14, 44, 32))
 
 
+
+@patch.object(twitter_direct_agent.collectorsdb, "engineFactory",
+              autospec=True)
+class TweetStorerTweetVolumeTestCase(unittest.TestCase):
+
+  def _createStorer(self):
+    return twitter_direct_agent.TweetStorer(tagger=Mock(),
+                                            aggSec=300,
+                                            msgQ=Mock(),
+                                            echoData=False)
+
+
+  def testCountNewTweetReferences(self, engineFactoryMock):
+    agg1 = datetime(2015, 8, 5, 14, 40)
+    agg2 = datetime(2015, 8, 5, 14, 45)
+    referenceRows = [
+      dict(metric="B", msg_uid="1", agg_ts=agg1),
+      dict(metric="A", msg_uid="1", agg_ts=agg1),
+      dict(metric="A", msg_uid="2", agg_ts=agg1),
+      # Duplicate within the batch
+      dict(metric="A", msg_uid="2", agg_ts=agg1),
+      # Already saved
+      dict(metric="A", msg_uid="3", agg_ts=agg1),
+      dict(metric="A", msg_uid="4", agg_ts=agg2),
+    ]
+
+    conn = Mock()
+    conn.execute.return_value.fetchall.return_value = [("A", "3")]
+
+    volumeRows = twitter_direct_agent.TweetStorer._countNewTweetReferences(
+      conn, referenceRows)
+
+    self.assertEqual(volumeRows, [
+      dict(agg_ts=agg1, metric="A", num_tweets=2),
+      dict(agg_ts=agg1, metric="B", num_tweets=1),
+      dict(agg_ts=agg2, metric="A", num_tweets=1)])
+
+
+  def testSaveTweetsUpdatesTweetVolumeInSameTransaction(self,
+                                                        engineFactoryMock):
+    storer = self._createStorer()
+    aggTs = datetime(2015, 8, 5, 14, 40)
+    storer._createTweetAndReferenceRows = Mock(
+      return_value=(dict(uid="1"),
+                    [dict(metric="A", msg_uid="1", agg_ts=aggTs)]))
+
+    conn = (engineFactoryMock.return_value.begin.return_value
+            .__enter__.return_value)
+    conn.execute.return_value.fetchall.return_value = []
+
+    storer._saveTweets([dict(id_str="1")], aggRefDatetime=aggTs)
+
+    self.assertEqual(engineFactoryMock.return_value.begin.call_count, 1)
+    self.assertEqual(conn.execute.call_count, 4)
+    self.assertEqual(
+      conn.execute.call_args_list[-1][0],
+      (twitter_direct_agent._INCREMENT_TWEET_VOLUME_SQL,
+       [dict(agg_ts=aggTs, metric="A", num_tweets=1)]))
+
+
+
+@patch.object(twitter_direct_agent.collectorsdb, "engineFactory",
+              autospec=True)
+class TweetStorerTaggingTestCase(unittest.TestCase):
+
+  def testReapMessagesTagsOnlyUndecodedTweets(self, _engineFactoryMock):
+    tagger = Mock(spec_set=twitter_direct_agent.tweet_tagging.TweetTagger)
+    tagger.tag.side_effect = (
+      lambda msg: msg.setdefault("metricTagSet", set(["A"])))
+
+    storer = twitter_direct_agent.TweetStorer(tagger=tagger,
+                                              aggSec=300,
+                                              msgQ=Mock(),
+                                              echoData=False)
+
+    # Decoded and tagged by TweetTaggingPool
+    preTagged = dict(in_reply_to_status_id=None, metricTagSet=set(["B"]))
+    untagged = dict(in_reply_to_status_id=None, metricTagSet=set())
+
+    tweets, deletes = storer._reapMessages(
+      [
+        twitter_direct_agent.TwitterStreamListener.ConnectionMarker,
+        json.dumps(dict(in_reply_to_status_id=None)),
+        preTagged,
+        untagged,
+        dict(delete=dict(status=dict(id_str="1"))),
+      ])
+
+    self.assertEqual(tagger.tag.call_count, 1)
+    self.assertEqual(tweets, [
+      dict(in_reply_to_status_id=None, metricTagSet=set(["A"])),
+      preTagged])
+    self.assertEqual(deletes, [dict(delete=dict(status=dict(id_str="1")))])
+    self.assertEqual(storer._currentStreamStats.numTweets, 3)
+    self.assertEqual(storer._currentStreamStats.numUntaggedTweets, 1)
+
+
+
+@patch.object(twitter_direct_agent.metric_utils,
+              "updateLastEmittedSampleDatetime", autospec=True)
+@patch.object(twitter_direct_agent.metric_utils, "metricDataBatchWrite",
+              autospec=True)
+@patch.object(twitter_direct_agent.collectorsdb, "engineFactory",
+              autospec=True)
+class MetricDataForwarderTestCase(unittest.TestCase):
+
+  def _createForwarder(self, metrics):
+    metricSpecs = [
+      twitter_direct_agent.TwitterMetricSpec(resource="Company",
+                                             metric=metric,
+                                             screenNames=[],
+                                             symbol="SYM")
+      for metric in metrics
+    ]
+    return twitter_direct_agent.MetricDataForwarder(metricSpecs=metricSpecs,
+                                                    aggSec=300)
+
+
+  def testCatchUpQueriesAndAdvancesWatermarkPerChunk(
+      self, engineFactoryMock, metricDataBatchWriteMock,
+      updateLastEmittedSampleDatetimeMock):
+    forwarder = self._createForwarder(["A", "B"])
+    period = timedelta(seconds=300)
+
+    lastEmittedAggTime = datetime(2015, 8, 5, 0, 0)
+    numIntervals = 2 * forwarder._MAX_INTERVALS_PER_CHUNK + 10
+    stopDatetime = lastEmittedAggTime + period * (numIntervals + 1)
+
+    queryRanges = []
+    def queryTweetVolumesInRange(aggStartDatetime, stopDatetime, metrics):
+      queryRanges.append((aggStartDatetime, stopDatetime))
+      return {(lastEmittedAggTime + period, "A"): 3,
+              (lastEmittedAggTime + period * 2, "B"): 5}
+
+    forwarder._queryTweetVolumesInRange = Mock(
+      side_effect=queryTweetVolumesInRange)
+
+    result = forwarder._forwardTweetVolumeMetrics(
+      lastEmittedAggTime=lastEmittedAggTime,
+      stopDatetime=stopDatetime)
+
+    self.assertEqual(result, lastEmittedAggTime + period * numIntervals)
+
+    # One grouped query per chunk
+    chunkStarts = [lastEmittedAggTime + period,
+                   lastEmittedAggTime + period * 289,
+                   lastEmittedAggTime + period * 577]
+    self.assertEqual(queryRanges,
+                     zip(chunkStarts, chunkStarts[1:] + [stopDatetime]))
+
+    # The watermark advanced once per chunk
+    self.assertEqual(
+      [kwargs["sampleDatetime"] for _, kwargs in
+       updateLastEmittedSampleDatetimeMock.call_args_list],
+      [start - period for start in chunkStarts[1:]] + [result])
+
+    # Every interval was emitted for every metric, with zero for no tweets
+    putSample = metricDataBatchWriteMock.return_value.__enter__.return_value
+    samples = [kwargs for _, kwargs in putSample.call_args_list]
+    self.assertEqual(len(samples), 2 * numIntervals)
+    self.assertEqual(samples[:4], [
+      dict(metricName="A", value=3, epochTimestamp=1438733100),
+      dict(metricName="B", value=0, epochTimestamp=1438733100),
+      dict(metricName="A", value=0, epochTimestamp=1438733400),
+      dict(metricName="B", value=5, epochTimestamp=1438733400)])
+
+
+  def testFailedChunkReturnsLastEmittedAggTime(
+      self, engineFactoryMock, metricDataBatchWriteMock,
+      updateLastEmittedSampleDatetimeMock):
+    forwarder = self._createForwarder(["A"])
+    period = timedelta(seconds=300)
+
+    lastEmittedAggTime = datetime(2015, 8, 5, 0, 0)
+    forwarder._queryTweetVolumesInRange = Mock(
+      side_effect=[dict(), Exception("db unavailable")])
+
+    result = forwarder._forwardTweetVolumeMetrics(
+      lastEmittedAggTime=lastEmittedAggTime,
+      stopDatetime=lastEmittedAggTime + period * 400)
+
+    self.assertEqual(
+      result,
+      lastEmittedAggTime + period * forwarder._MAX_INTERVALS_PER_CHUNK)
+    updateLastEmittedSampleDatetimeMock.assert_called_once_with(
+      key=twitter_direct_agent._EMITTED_TWEET_VOLUME_SAMPLE_TRACKER_KEY,
+      sampleDatetime=result)
+
+
+  def testForwardSingleInterval(
+      self, engineFactoryMock, metricDataBatchWriteMock,
+      updateLastEmittedSampleDatetimeMock):
+    forwarder = self._createForwarder(["A"])
+
+    lastEmittedAggTime = datetime(2015, 8, 5, 0, 0)
+    forwarder._queryTweetVolumesInRange = Mock(return_value=dict())
+
+    # Upper bound need not be aligned on an aggregation interval
+    result = forwarder._forwardTweetVolumeMetrics(
+      lastEmittedAggTime=lastEmittedAggTime,
+      stopDatetime=datetime(2015, 8, 5, 0, 7))
+
+    self.assertEqual(result, datetime(2015, 8, 5, 0, 5))
+    forwarder._queryTweetVolumesInRange.assert_called_once_with(
+      datetime(2015, 8, 5, 0, 5), datetime(2015, 8, 5, 0, 10), None)
+
+
+
 if __name__ == "__main__":
   unittest.main()
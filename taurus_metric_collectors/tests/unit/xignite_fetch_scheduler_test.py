@@ -0,0 +1,201 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+unit tests for taurus_metric_collectors.xignite.xignite_fetch_scheduler
+"""
+
+import threading
+import unittest
+
+from mock import patch
+
+from taurus_metric_collectors import logging_support
+from taurus_metric_collectors.xignite.xignite_fetch_scheduler import (
+  SymbolBackoff,
+  TokenBucket,
+  XigniteFetchScheduler)
+
+
+
+def setUpModule():
+  logging_support.LoggingSupport.initTestApp()
+
+
+
+class _FakeClock(object):
+  """ Clock whose time only advances when sleeping """
+
+  def __init__(self):
+    self.now = 1000.0
+    self.sleeps = []
+
+
+  def time(self):
+    return self.now
+
+
+  def sleep(self, duration):
+    self.sleeps.append(duration)
+    self.now += duration
+
+
+
+class TokenBucketTestCase(unittest.TestCase):
+
+  def testInvalidParams(self):
+    with self.assertRaises(ValueError):
+      TokenBucket(ratePerSec=0, capacity=1)
+
+    with self.assertRaises(ValueError):
+      TokenBucket(ratePerSec=1, capacity=0)
+
+
+  def testBurstThenRateLimited(self):
+    clock = _FakeClock()
+    bucket = TokenBucket(ratePerSec=4, capacity=2, clock=clock.time,
+                         sleep=clock.sleep)
+
+    # The bucket starts out full
+    bucket.acquire()
+    bucket.acquire()
+    self.assertEqual(clock.sleeps, [])
+
+    # Then tokens are added at the given rate
+    bucket.acquire()
+    bucket.acquire()
+    self.assertEqual(clock.sleeps, [0.25, 0.25])
+
+
+  def testRefillIsCappedByCapacity(self):
+    clock = _FakeClock()
+    bucket = TokenBucket(ratePerSec=10, capacity=3, clock=clock.time,
+                         sleep=clock.sleep)
+
+    clock.now += 100
+    for _ in xrange(3):
+      bucket.acquire()
+    self.assertEqual(clock.sleeps, [])
+
+    bucket.acquire()
+    self.assertEqual(len(clock.sleeps), 1)
+    self.assertAlmostEqual(clock.sleeps[0], 0.1)
+
+
+
+class SymbolBackoffTestCase(unittest.TestCase):
+
+  def testExponentialBackoffAndReset(self):
+    clock = _FakeClock()
+    backoff = SymbolBackoff(initialDelaySec=10, maxDelaySec=35,
+                            clock=clock.time)
+
+    self.assertTrue(backoff.isReady("AAPL"))
+
+    self.assertEqual(backoff.recordFailure("AAPL"), 10)
+    self.assertFalse(backoff.isReady("AAPL"))
+    self.assertTrue(backoff.isReady("GOOG"))
+
+    clock.now += 10
+    self.assertTrue(backoff.isReady("AAPL"))
+
+    self.assertEqual(backoff.recordFailure("AAPL"), 20)
+    self.assertEqual(backoff.recordFailure("AAPL"), 35)
+
+    backoff.recordSuccess("AAPL")
+    self.assertTrue(backoff.isReady("AAPL"))
+    self.assertEqual(backoff.recordFailure("AAPL"), 10)
+
+
+
+class XigniteFetchSchedulerTestCase(unittest.TestCase):
+
+  def _createScheduler(self, **kwargs):
+    params = dict(numThreads=3, maxRequestsPerSec=1000, initialBackoffSec=60,
+                  maxBackoffSec=600)
+    params.update(kwargs)
+    scheduler = XigniteFetchScheduler(**params)
+    self.addCleanup(scheduler.close)
+    return scheduler
+
+
+  def testFetchAll(self):
+    scheduler = self._createScheduler()
+
+    sessions = set()
+    sessionsLock = threading.Lock()
+
+    def fetchFn(arg, httpSession, rateLimit):
+      rateLimit()
+      with sessionsLock:
+        sessions.add(httpSession)
+      return arg * 2
+
+    symbolToArgs = dict(("SYM%d" % (i,), i) for i in xrange(20))
+
+    results = scheduler.fetchAll(symbolToArgs, fetchFn)
+
+    self.assertEqual(results,
+                     dict((symbol, arg * 2)
+                          for symbol, arg in symbolToArgs.iteritems()))
+
+    # HTTP sessions are reused by the threads
+    self.assertLessEqual(len(sessions), 3)
+
+
+  @patch("taurus_metric_collectors.xignite.xignite_fetch_scheduler._LOG",
+         autospec=True)
+  def testFailedSymbolsBackOff(self, _LOG):
+    scheduler = self._createScheduler()
+
+    calls = []
+    callsLock = threading.Lock()
+
+    def fetchFn(symbol, httpSession, rateLimit):
+      with callsLock:
+        calls.append(symbol)
+      if symbol == "BAD":
+        raise Exception("Test exception")
+      return symbol
+
+    symbolToArgs = {"GOOD": "GOOD", "BAD": "BAD"}
+
+    self.assertEqual(scheduler.fetchAll(symbolToArgs, fetchFn),
+                     {"GOOD": "GOOD"})
+    self.assertTrue(_LOG.exception.called)
+    self.assertItemsEqual(calls, ["GOOD", "BAD"])
+
+    # The failed symbol is skipped while backing off
+    del calls[:]
+    self.assertEqual(scheduler.fetchAll(symbolToArgs, fetchFn),
+                     {"GOOD": "GOOD"})
+    self.assertEqual(calls, ["GOOD"])
+
+
+  def testMap(self):
+    scheduler = self._createScheduler()
+
+    self.assertEqual(scheduler.map(lambda x: x + 1, [1, 2, 3]), [2, 3, 4])
+
+
+
+if __name__ == "__main__":
+  unittest.main()
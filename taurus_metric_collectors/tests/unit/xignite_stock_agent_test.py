@@ -22,7 +22,7 @@
 from collections import defaultdict
 import datetime
 import json
-from mock import call, Mock, patch
+from mock import call, MagicMock, Mock, patch
 import StringIO
 import sys
 import unittest
@@ -47,30 +47,74 @@ def setUpModule():
   autospec=True)
 class XigniteStockAgentTestCase(unittest.TestCase):
 
-  @patch("taurus_metric_collectors.xignite.xignite_stock_agent.Pool",
-    autospec=True)
+  @patch("taurus_metric_collectors.xignite.xignite_stock_agent"
+         ".XigniteFetchScheduler",
+         autospec=True)
+  @patch("taurus_metric_collectors.xignite.xignite_stock_agent._saveNewBars",
+         autospec=True)
+  @patch("taurus_metric_collectors.xignite.xignite_stock_agent"
+         "._purgeOldRecords",
+         autospec=True)
+  @patch("taurus_metric_collectors.xignite.xignite_stock_agent.collectorsdb",
+         autospec=True)
+  @patch("taurus_metric_collectors.xignite.xignite_stock_agent.g_opMode",
+         new=taurus_metric_collectors.ApplicationConfig.OP_MODE_ACTIVE)
   @patch("taurus_metric_collectors.xignite.xignite_stock_agent.time",
   autospec=True)
-  def testMain(self, time, Pool, urllib2, metricDataBatchWriter):
+  def testMain(self, time, collectorsdb, _purgeOldRecords, _saveNewBars,
+               XigniteFetchScheduler, urllib2, metricDataBatchWriter):
     # Load metric specs from metric configuration
     symbolToMetricSpecs = defaultdict(list)
     for spec in xignite_stock_agent.loadMetricSpecs():
       symbolToMetricSpecs[spec.symbol].append(spec)
 
-    symbolIter = symbolToMetricSpecs.itervalues()
+    symbols = symbolToMetricSpecs.keys()[:3]
 
+    time.time.return_value = 0
     time.sleep.side_effect = [None, None, KeyboardInterrupt()]
-    Pool.return_value.imap_unordered.return_value = iter([
-      ({"Symbol": next(symbolIter)[0].symbol}, [Mock()]),
-      ({"Symbol": next(symbolIter)[0].symbol}, [Mock()]),
-      ({"Symbol": next(symbolIter)[0].symbol}, [Mock()])
-    ])
-    with patch.object(sys, "argv", [None, "--apitoken=foobar"]):
+
+    security0 = {"Symbol": symbols[0]}
+    security1 = {"Symbol": symbols[1]}
+    scheduler = XigniteFetchScheduler.return_value
+    scheduler.fetchAll.return_value = {
+      symbols[0]: (security0, [Mock()]),
+      symbols[1]: (security1, [Mock()]),
+      symbols[2]: ({"Symbol": symbols[2]}, [])
+    }
+    _saveNewBars.return_value = [symbols[0], symbols[1]]
+
+    with patch.object(sys, "argv", [None, "--apitoken=foobar",
+                                    "--fetch-threads=7",
+                                    "--max-requests-per-sec=3"]):
       xignite_stock_agent.main()
 
-    self.assertTrue(Pool.called)
-    self.assertEqual(Pool.return_value.imap_unordered.call_count, 3)
-    self.assertEqual(Pool.return_value.apply_async.call_count, 6)
+    self.assertEqual(XigniteFetchScheduler.call_count, 1)
+    self.assertEqual(XigniteFetchScheduler.call_args[1]["numThreads"], 7)
+    self.assertEqual(XigniteFetchScheduler.call_args[1]["maxRequestsPerSec"],
+                     3)
+
+    # Three polling cycles
+    self.assertEqual(scheduler.fetchAll.call_count, 3)
+    self.assertItemsEqual(scheduler.fetchAll.call_args[0][0].keys(),
+                          symbolToMetricSpecs.keys())
+
+    # New bars of all symbols are saved together
+    self.assertEqual(_saveNewBars.call_count, 3)
+    self.assertItemsEqual(
+      [security for security, _ in _saveNewBars.call_args[0][1]],
+      [security0, security1])
+
+    # Unsent samples of symbols with new data are forwarded
+    self.assertEqual(scheduler.map.call_count, 3)
+    self.assertItemsEqual(scheduler.map.call_args[0][1],
+                          [symbols[0], symbols[1]])
+
+    self.assertEqual(_purgeOldRecords.call_count, 3)
+
+    # Full cycle duration, since no time elapsed during the cycle
+    time.sleep.assert_called_with(60 * xignite_stock_agent.DEFAULT_BARLENGTH)
+
+    scheduler.close.assert_called_once_with()
 
 
   def testGetEasternLocalizedTimestampFromSample(self,
@@ -662,5 +706,72 @@ class XigniteStockAgentTestCase(unittest.TestCase):
 
 
 
+  def testSaveNewBars(self, urllib2, metricDataBatchWriter):
+    def createSecurity(symbol):
+      return {"Symbol": symbol,
+              "CIK": None,
+              "CUSIP": None,
+              "ISIN": None,
+              "Valoren": None,
+              "Name": symbol,
+              "Market": "NASDAQ",
+              "MarketIdentificationCode": "XNAS",
+              "MostLiquidExchange": True,
+              "CategoryOrIndustry": None}
+
+    def createSample(startTime, endTime):
+      return {"StartDate": "1/15/2015",
+              "StartTime": startTime,
+              "EndDate": "1/15/2015",
+              "EndTime": endTime,
+              "UTCOffset": -5,
+              "Open": 46.225,
+              "High": 46.38,
+              "Low": 45.955,
+              "Close": 45.96,
+              "Volume": 504494,
+              "Trades": 2414}
+
+    engine = Mock()
+    engine.begin.return_value = MagicMock()
+    conn = engine.begin.return_value.__enter__.return_value
+
+    savedSymbols = xignite_stock_agent._saveNewBars(
+      engine,
+      [(createSecurity("MSFT"), [createSample("9:30:00 AM", "9:35:00 AM"),
+                                 createSample("9:35:00 AM", "9:40:00 AM")]),
+       # After market hours only
+       (createSecurity("AAPL"), [createSample("4:00:00 PM", "4:05:00 PM")]),
+       (createSecurity("GOOG"), [createSample("9:30:00 AM", "9:35:00 AM")])])
+
+    self.assertEqual(savedSymbols, ["MSFT", "GOOG"])
+
+    # Securities and bars of all symbols are inserted in a single transaction
+    engine.begin.assert_called_once_with()
+    self.assertEqual(conn.execute.call_count, 2)
+
+    securityRows = conn.execute.call_args_list[0][0][1]
+    self.assertEqual([row["symbol"] for row in securityRows], ["MSFT", "GOOG"])
+
+    barRows = conn.execute.call_args_list[1][0][1]
+    self.assertEqual(
+      [(row["symbol"], row["StartTime"]) for row in barRows],
+      [("MSFT", datetime.time(9, 30)),
+       ("MSFT", datetime.time(9, 35)),
+       ("GOOG", datetime.time(9, 30))])
+    self.assertEqual(barRows[0]["EndDate"], datetime.date(2015, 1, 15))
+    self.assertEqual(barRows[0]["EndTime"], datetime.time(9, 35))
+    self.assertEqual(barRows[0]["Volume"], 504494)
+
+
+  def testSaveNewBarsWithoutBars(self, urllib2, metricDataBatchWriter):
+    engine = Mock()
+
+    self.assertEqual(
+      xignite_stock_agent._saveNewBars(engine, [({"Symbol": "MSFT"}, [])]),
+      [])
+    self.assertFalse(engine.begin.called)
+
+
 if __name__ == "__main__":
   unittest.main()
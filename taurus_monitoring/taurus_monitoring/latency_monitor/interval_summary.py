@@ -0,0 +1,181 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+""" Incrementally-maintained statistics of the intervals between a model's
+samples, persisted between runs of the model latency monitor so that each run
+only needs to query the samples that arrived since the previous one.
+"""
+
+import datetime
+import json
+import logging
+import math
+import os
+import tempfile
+
+import pytz
+
+
+
+_UTC_TZ = pytz.timezone("UTC")
+
+# Format of timestamps in the persisted summaries; same as in the metric data
+# DynamoDB table
+_TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+_DATE_FORMAT = "%Y-%m-%d"
+
+
+
+g_logger = logging.getLogger(__name__)
+
+
+
+class IntervalSummary(object):
+  """ Count, mean and sum of squared deviations (M2) of the intervals between
+  consecutive samples of a model, bucketed by the UTC date of the later sample
+  so that days that fall out of the window can be evicted. Buckets are merged
+  with the parallel variance algorithm of Chan et al.
+  """
+
+  def __init__(self, lastTimestamp=None, dailyStats=None):
+    """
+    :param datetime lastTimestamp: UTC-localized timestamp of the most recent
+      sample; None if none
+    :param dict dailyStats: date -> [count, mean, M2] of the intervals ending
+      on that date
+    """
+    self.lastTimestamp = lastTimestamp
+    self.dailyStats = dailyStats if dailyStats is not None else {}
+
+
+  def addSample(self, timestamp):
+    """ Account for a sample newer than lastTimestamp; ignores older samples
+
+    :param datetime timestamp: UTC-localized timestamp of the sample
+    """
+    if self.lastTimestamp is not None:
+      if timestamp <= self.lastTimestamp:
+        return
+
+      interval = (timestamp - self.lastTimestamp).total_seconds()
+
+      stats = self.dailyStats.setdefault(timestamp.date(), [0, 0.0, 0.0])
+      stats[0] += 1
+      delta = interval - stats[1]
+      stats[1] += delta / stats[0]
+      stats[2] += delta * (interval - stats[1])
+
+    self.lastTimestamp = timestamp
+
+
+  def evictBefore(self, date):
+    """ Discard the statistics of intervals ending before the given date """
+    for day in [day for day in self.dailyStats if day < date]:
+      del self.dailyStats[day]
+
+
+  def getStats(self):
+    """
+    :returns: (count, mean, stddev) of the intervals; stddev is the population
+      standard deviation like numpy.std(); (0, None, None) if there are no
+      intervals
+    """
+    count = 0
+    mean = 0.0
+    m2 = 0.0
+    for dayCount, dayMean, dayM2 in self.dailyStats.itervalues():
+      if not dayCount:
+        continue
+      newCount = count + dayCount
+      delta = dayMean - mean
+      mean += delta * dayCount / newCount
+      m2 += dayM2 + delta * delta * count * dayCount / newCount
+      count = newCount
+
+    if not count:
+      return 0, None, None
+
+    return count, mean, math.sqrt(m2 / count)
+
+
+  def toJSONable(self):
+    return {
+      "lastTimestamp": (self.lastTimestamp.strftime(_TIMESTAMP_FORMAT)
+                        if self.lastTimestamp is not None else None),
+      "dailyStats": dict((day.strftime(_DATE_FORMAT), stats)
+                         for day, stats in self.dailyStats.iteritems())
+    }
+
+
+  @classmethod
+  def fromJSONable(cls, obj):
+    lastTimestamp = obj["lastTimestamp"]
+    if lastTimestamp is not None:
+      lastTimestamp = _UTC_TZ.localize(
+        datetime.datetime.strptime(lastTimestamp, _TIMESTAMP_FORMAT))
+
+    return cls(
+      lastTimestamp=lastTimestamp,
+      dailyStats=dict(
+        (datetime.datetime.strptime(day, _DATE_FORMAT).date(), list(stats))
+        for day, stats in obj["dailyStats"].iteritems()))
+
+
+
+def loadSummaries(path):
+  """ Load interval summaries saved by `saveSummaries()`
+
+  :param str path: path of the summaries file; a missing or unreadable file
+    yields no summaries, so that the next run recomputes them from scratch
+  :returns: dict of model uid -> IntervalSummary
+  """
+  if not os.path.exists(path):
+    return {}
+
+  try:
+    with open(path) as fileObj:
+      return dict((uid, IntervalSummary.fromJSONable(obj))
+                  for uid, obj in json.load(fileObj).iteritems())
+  except (ValueError, KeyError, TypeError):
+    g_logger.exception("Discarding unreadable interval summaries file=%s",
+                       path)
+    return {}
+
+
+
+def saveSummaries(path, summaries):
+  """ Atomically replace the summaries file
+
+  :param str path: path of the summaries file
+  :param dict summaries: model uid -> IntervalSummary
+  """
+  dirPath = os.path.dirname(os.path.abspath(path))
+  fd, tempPath = tempfile.mkstemp(dir=dirPath, prefix=".interval_summaries")
+  try:
+    with os.fdopen(fd, "w") as fileObj:
+      json.dump(dict((uid, summary.toJSONable())
+                     for uid, summary in summaries.iteritems()),
+                fileObj)
+    os.rename(tempPath, path)
+  except Exception:
+    os.remove(tempPath)
+    raise
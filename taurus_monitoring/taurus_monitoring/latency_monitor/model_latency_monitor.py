@@ -20,23 +20,31 @@
 # ----------------------------------------------------------------------
 
 from collections import namedtuple
+import json
 import logging
 import datetime
+from multiprocessing.pool import ThreadPool
+import os
+import threading
 
 import boto.dynamodb2
 from boto.dynamodb2.table import Table
-import numpy
 import pytz
 import requests
 
 from nta.utils import error_reporting
 from nta.utils.dynamodb_utils import retryOnTransientDynamoDBError
 
-from taurus_monitoring import (loadConfig,
+from taurus_monitoring import (CONF_DIR,
+                               loadConfig,
                                loadEmailParamsFromConfig,
                                logging_support,
                                MonitorOptionParser,
                                TaurusMonitorError)
+from taurus_monitoring.latency_monitor.interval_summary import (
+  IntervalSummary,
+  loadSummaries,
+  saveSummaries)
 from taurus_monitoring.monitor_dispatcher import MonitorDispatcher
 
 
@@ -50,6 +58,13 @@ SIGMA_MULTIPLIER = 3 # Standard deviation multiplier.  According to 68-95-99.7
                      # purposes, intervals greater than 3 x stddev are
                      # exceptional for that data set
 FIXED_WINDOW = 14 # Number of days over which to calculate stddev.
+CONCURRENCY = 16 # Max number of concurrent DynamoDB queries
+
+# NASDAQ and NYSE market closures; see conf/market_holidays.json
+DEFAULT_MARKET_HOLIDAYS_PATH = os.path.join(CONF_DIR, "market_holidays.json")
+
+# Format of timestamps in the metric data DynamoDB table
+_DYNAMODB_TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
 
 # UTC datetime objects will be converted to US/Eastern local time for purposes
 # of determining market closure
@@ -86,14 +101,47 @@ class LatencyMonitorError(TaurusMonitorError):
 
 
 
-def isOutsideMarketHours(utcnow):
+def loadMarketHolidays(path=DEFAULT_MARKET_HOLIDAYS_PATH):
+  """ Load market closure dates from a JSON file with a "closures" list of
+  "YYYY-MM-DD" dates
+
+  :param str path: path of the market holidays file
+  :returns: market-local dates on which the market is closed
+  :rtype: frozenset of datetime.date
+  """
+  with open(path) as fileObj:
+    closures = json.load(fileObj)["closures"]
+
+  return frozenset(datetime.datetime.strptime(closure, "%Y-%m-%d").date()
+                   for closure in closures)
+
+
+
+_g_defaultMarketHolidays = None
+
+
+
+def _getDefaultMarketHolidays():
+  global _g_defaultMarketHolidays  # pylint: disable=W0603
+  if _g_defaultMarketHolidays is None:
+    _g_defaultMarketHolidays = loadMarketHolidays()
+  return _g_defaultMarketHolidays
+
+
+
+def isOutsideMarketHours(utcnow, marketHolidays=None):
   """ Determines whether or not the passed time is within a time period during
   which we should expect recent stock data.
 
   :param datetime utcnow: UTC-localized timestamp
+  :param marketHolidays: market-local dates on which the market is closed; None
+    for those in DEFAULT_MARKET_HOLIDAYS_PATH
   :returns: Truth value for whether or not passed utcnow param is outside of
     expected market hours
   """
+  if marketHolidays is None:
+    marketHolidays = _getDefaultMarketHolidays()
+
   # Adjust utcnow for market hours...
   marketLocalTime = utcnow.astimezone(_EASTERN_TZ)
 
@@ -101,66 +149,7 @@ def isOutsideMarketHours(utcnow):
     # Weekday is 5 (saturday) or 6 (sunday)
     return True
 
-  # NASDAQ and NYSE holidays through 2020, according to
-  # http://markets.on.nytimes.com/research/markets/holidays/holidays.asp
-  marketClosureHolidays = {
-    datetime.date(2015, 1, 1),
-    datetime.date(2015, 1, 19),
-    datetime.date(2015, 2, 16),
-    datetime.date(2015, 4, 3),
-    datetime.date(2015, 5, 25),
-    datetime.date(2015, 7, 3),
-    datetime.date(2015, 9, 7),
-    datetime.date(2015, 11, 26),
-    datetime.date(2015, 12, 25),
-    datetime.date(2016, 1, 1),
-    datetime.date(2016, 1, 18),
-    datetime.date(2016, 2, 15),
-    datetime.date(2016, 3, 25),
-    datetime.date(2016, 5, 30),
-    datetime.date(2016, 7, 4),
-    datetime.date(2016, 9, 5),
-    datetime.date(2016, 11, 24),
-    datetime.date(2016, 12, 26),
-    datetime.date(2017, 1, 2),
-    datetime.date(2017, 1, 16),
-    datetime.date(2017, 2, 20),
-    datetime.date(2017, 4, 14),
-    datetime.date(2017, 5, 29),
-    datetime.date(2017, 7, 4),
-    datetime.date(2017, 9, 4),
-    datetime.date(2017, 11, 23),
-    datetime.date(2017, 12, 25),
-    datetime.date(2018, 1, 1),
-    datetime.date(2018, 1, 15),
-    datetime.date(2018, 2, 19),
-    datetime.date(2018, 3, 30),
-    datetime.date(2018, 5, 28),
-    datetime.date(2018, 7, 4),
-    datetime.date(2018, 9, 3),
-    datetime.date(2018, 11, 22),
-    datetime.date(2018, 12, 25),
-    datetime.date(2019, 1, 1),
-    datetime.date(2019, 1, 21),
-    datetime.date(2019, 2, 18),
-    datetime.date(2019, 4, 19),
-    datetime.date(2019, 5, 27),
-    datetime.date(2019, 7, 4),
-    datetime.date(2019, 9, 2),
-    datetime.date(2019, 11, 28),
-    datetime.date(2019, 12, 25),
-    datetime.date(2020, 1, 1),
-    datetime.date(2020, 1, 20),
-    datetime.date(2020, 2, 17),
-    datetime.date(2020, 4, 10),
-    datetime.date(2020, 5, 25),
-    datetime.date(2020, 7, 3),
-    datetime.date(2020, 9, 7),
-    datetime.date(2020, 11, 26),
-    datetime.date(2020, 12, 25)
-  }
-
-  if marketLocalTime.date() in marketClosureHolidays:
+  if marketLocalTime.date() in marketHolidays:
     # market-local date is a known market holiday
     return True
 
@@ -216,6 +205,27 @@ class ModelLatencyChecker(MonitorDispatcher):
                     type="int",
                     dest="days",
                     help="Default: {}".format(FIXED_WINDOW))
+  parser.add_option("--intervalSummaryPath",
+                    type="string",
+                    dest="intervalSummaryPath",
+                    help=("Path of file in which to persist per-model "
+                          "interval statistics between runs, so that each run "
+                          "only queries samples newer than the previous run's. "
+                          "If omitted, all samples of the last --days days are "
+                          "queried on every run."))
+  parser.add_option("--concurrency",
+                    default=CONCURRENCY,
+                    type="int",
+                    dest="concurrency",
+                    help=("Max number of concurrent DynamoDB queries "
+                          "(Default: {})").format(CONCURRENCY))
+  parser.add_option("--marketHolidaysPath",
+                    default=DEFAULT_MARKET_HOLIDAYS_PATH,
+                    type="string",
+                    dest="marketHolidaysPath",
+                    help=("Path of JSON file with a \"closures\" list of "
+                          "YYYY-MM-DD market holidays (Default: {})")
+                    .format(DEFAULT_MARKET_HOLIDAYS_PATH))
 
 
   def __init__(self):
@@ -230,6 +240,9 @@ class ModelLatencyChecker(MonitorDispatcher):
     if not options.metricDataTable:
       self.parser.error("You must specify a --metricDataTable argument.")
 
+    if options.concurrency < 1:
+      self.parser.error("--concurrency must be positive.")
+
     self.config = loadConfig(options)
     self.emailParams = loadEmailParamsFromConfig(self.config)
     self.apiKey = self.config.get("S1", "MODELS_MONITOR_TAURUS_API_KEY")
@@ -245,8 +258,20 @@ class ModelLatencyChecker(MonitorDispatcher):
 
     self.metricDataTable = options.metricDataTable
     self.days = options.days
+    self.intervalSummaryPath = options.intervalSummaryPath
+    self.concurrency = options.concurrency
+    self.marketHolidays = loadMarketHolidays(options.marketHolidaysPath)
     self.options = options
 
+    # DynamoDB connections are not thread-safe, so each query thread has its own
+    self._threadLocal = threading.local()
+
+    lastHolidayYear = max(holiday.year for holiday in self.marketHolidays)
+    if datetime.datetime.now(_UTC_TZ).year > lastHolidayYear:
+      g_logger.warning("Market holidays in %s end in %d; update them to avoid "
+                       "false positives on market holidays",
+                       options.marketHolidaysPath, lastHolidayYear)
+
     g_logger.info("Initialized %r", repr(self))
 
 
@@ -307,26 +332,70 @@ class ModelLatencyChecker(MonitorDispatcher):
       aws_secret_access_key=self.awsSecretAccessKey)
 
 
-  def getMetricData(self, metricUid):
+  def _getMetricDataTable(self):
+    """
+    :returns: the calling thread's boto Table of the metric data table
+    """
+    table = getattr(self._threadLocal, "metricDataTable", None)
+    if table is None:
+      table = Table(self.metricDataTable, connection=self._connectDynamoDB())
+      self._threadLocal.metricDataTable = table
+    return table
+
+
+  def _getWindowStart(self):
+    """
+    :returns: UTC-localized start of the window of samples whose intervals
+      are considered
+    """
+    now = datetime.datetime.now(_UTC_TZ)
+
+    return now - datetime.timedelta(days=self.days,
+                                    microseconds=now.microsecond)
+
+
+  def getMetricData(self, metricUid, since=None):
     """ Retrieve and return metric data from dynamodb
 
     :param str metricUid: Metric uid
-    :param str timestamp: Timestamp representing the lower bounds for metric
-      data samples to retrieve
+    :param datetime since: UTC-localized lower bound of the timestamps of the
+      samples to retrieve; defaults to the start of the --days window
     :returns: DynamoDB ResultSet (see
       http://boto.readthedocs.org/en/latest/dynamodb2_tut.html#the-resultset)
     """
-    # Query recent DynamoDB metric data for each model
-    now = datetime.datetime.now(_UTC_TZ)
-
-    then = now - datetime.timedelta(days=self.days,
-                                    microseconds=now.microsecond)
+    if since is None:
+      since = self._getWindowStart()
 
-    conn = self._connectDynamoDB()
-    metricDataTable = Table(self.metricDataTable, connection=conn)
+    metricDataTable = self._getMetricDataTable()
 
     return retryOnTransientDynamoDBError(g_logger)(metricDataTable.query_2)(
-      uid__eq=metricUid, timestamp__gte=then.strftime("%Y-%m-%d %H:%M:%S"))
+      uid__eq=metricUid,
+      timestamp__gte=since.strftime(_DYNAMODB_TIMESTAMP_FORMAT))
+
+
+  def _updateIntervalSummary(self, metricUid, summary, windowStart):
+    """ Fold the samples newer than the summary's last sample into the summary
+    and evict intervals that fell out of the window
+
+    :param str metricUid: Metric uid
+    :param IntervalSummary summary: the model's summary; updated in place
+    :param datetime windowStart: UTC-localized start of the window
+    """
+    since = windowStart
+    if (summary.lastTimestamp is not None and
+        summary.lastTimestamp > windowStart):
+      since = summary.lastTimestamp
+
+    for sample in self.getMetricData(metricUid=metricUid, since=since):
+      # Track only the intervals between valid (e.g. non-zero) samples
+      if not sample["metric_value"]:
+        continue
+
+      summary.addSample(
+        _UTC_TZ.localize(datetime.datetime.strptime(
+          sample["timestamp"], _DYNAMODB_TIMESTAMP_FORMAT)))
+
+    summary.evictBefore(windowStart.date())
 
 
   @MonitorDispatcher.registerCheck
@@ -341,42 +410,51 @@ class ModelLatencyChecker(MonitorDispatcher):
 
     errors = []
 
-    for model in models:
-
-      # Calculate current UTC timestamp adjusted to account for acceptable
-      # 10-minute delay in processing.
-      utcnow = datetime.datetime.now(_UTC_TZ) - datetime.timedelta(minutes=10)
-
-      # Skip processing of models outside of market hours to avoid false
-      # positives
-      if isOutsideMarketHours(utcnow):
-        g_logger.debug("Skipping %s.  Reason: outside market hours",
-                       model["name"])
-        continue
-
-      resultSet = self.getMetricData(metricUid=model["uid"])
-      # Track all time intervals between valid (e.g. non-zero) samples
-      intervals = []
-
-      lastSampleTimestamp = None
-      for sample in resultSet:
-
-        if not sample["metric_value"]:
-          continue
-
-        timestamp = (
-          _UTC_TZ.localize(datetime.datetime.strptime(sample["timestamp"],
-                                                      "%Y-%m-%dT%H:%M:%S"))
-        )
-
-        if lastSampleTimestamp is None:
-          lastSampleTimestamp = timestamp
-          continue
-
-        intervals.append((timestamp - lastSampleTimestamp).total_seconds())
-        lastSampleTimestamp = timestamp
-
-      if not intervals:
+    # Calculate current UTC timestamp adjusted to account for acceptable
+    # 10-minute delay in processing.
+    utcnow = datetime.datetime.now(_UTC_TZ) - datetime.timedelta(minutes=10)
+
+    # Skip processing of models outside of market hours to avoid false
+    # positives
+    modelsToCheck = models
+    if isOutsideMarketHours(utcnow, self.marketHolidays):
+      g_logger.debug("Skipping %d models.  Reason: outside market hours",
+                     len(models))
+      modelsToCheck = []
+
+    if self.intervalSummaryPath is not None:
+      summaries = loadSummaries(self.intervalSummaryPath)
+    else:
+      summaries = {}
+
+    # Discard summaries of deleted models
+    summaries = dict((model["uid"], summaries.get(model["uid"]) or
+                      IntervalSummary())
+                     for model in modelsToCheck)
+
+    windowStart = self._getWindowStart()
+
+    if modelsToCheck:
+      pool = ThreadPool(processes=min(self.concurrency, len(modelsToCheck)))
+      try:
+        pool.map(
+          lambda model: self._updateIntervalSummary(model["uid"],
+                                                    summaries[model["uid"]],
+                                                    windowStart),
+          modelsToCheck)
+      finally:
+        pool.close()
+        pool.join()
+
+      if self.intervalSummaryPath is not None:
+        saveSummaries(self.intervalSummaryPath, summaries)
+
+    for model in modelsToCheck:
+      summary = summaries[model["uid"]]
+
+      count, mean, stddev = summary.getStats()
+
+      if not count:
         errors.append(
           LatencyMonitorErrorParams(model["name"], model["uid"], None, None)
         )
@@ -387,12 +465,10 @@ class ModelLatencyChecker(MonitorDispatcher):
       # market hours, we still count intervals included in off-market hours.
       # It's ok, though.  The math still works out and we'll catch metrics for
       # which we stop receiving data anyway.
-      stddev = numpy.nanstd(intervals)  # pylint: disable=E1101
-      mean = numpy.mean(intervals)  # pylint: disable=E1101
 
       # Fabricate a hypothetical interval representing the amount of time since
       # the most recent valid timestamp
-      currentInterval = (utcnow - lastSampleTimestamp).total_seconds()
+      currentInterval = (utcnow - summary.lastTimestamp).total_seconds()
 
       # Only consider intervals that are more than N sigma AND above an
       # arbitrary minimum threshold.  More frequent companies will have a
@@ -409,7 +485,7 @@ class ModelLatencyChecker(MonitorDispatcher):
         errors.append(LatencyMonitorErrorParams(model["name"],
                                                 model["uid"],
                                                 acceptableThreshold,
-                                                lastSampleTimestamp))
+                                                summary.lastTimestamp))
 
     g_logger.info("Processed statistics for %d model%s, found %d error%s.",
                   len(models),
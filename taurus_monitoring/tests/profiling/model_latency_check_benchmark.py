@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+"""
+Benchmark ModelLatencyChecker.checkAllModelLatency over many models against a
+fake DynamoDB metric data table with simulated query latency: the former
+sequential full-window queries versus concurrent queries of only the samples
+that arrived since the previous run's interval summaries.
+"""
+
+import bisect
+import datetime
+from optparse import OptionParser
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from mock import Mock, patch
+import pytz
+
+from nta.utils.test_utils import patch_helpers
+
+from taurus_monitoring.latency_monitor import model_latency_monitor
+
+
+
+_UTC_TZ = pytz.timezone("UTC")
+
+_MONITOR_CONF = """[S1]
+MODELS_MONITOR_TAURUS_API_KEY=taurusApiKey
+MODELS_MONITOR_TAURUS_MODELS_URL=taurusModelsUrl
+MODELS_MONITOR_EMAIL_AWS_REGION=emailRegion
+MODELS_MONITOR_EMAIL_SES_ENDPOINT=sesEndpoint
+MODELS_MONITOR_EMAIL_SENDER_ADDRESS=sender@domain.tld
+MODELS_MONITOR_EMAIL_RECIPIENTS=recipient@domain.tld
+MODELS_MONITOR_TAURUS_DYNAMODB_REGION=dynamodbRegion
+MODELS_MONITOR_TAURUS_DYNAMODB_AWS_ACCESS_KEY_ID=awsAccessKeyId
+MODELS_MONITOR_TAURUS_DYNAMODB_AWS_SECRET_ACCESS_KEY=awsSecretAccessKey
+"""
+
+# DynamoDB returns query results in pages of up to 1MB
+_ITEMS_PER_PAGE = 5000
+
+
+
+class _FakeMetricDataTable(object):
+  """ Serves the same 5-minute samples for every uid, from `startTime` up to
+  `endTime`; each page of results costs a simulated round trip
+  """
+
+  def __init__(self, startTime, endTime, roundTripSec):
+    self.endTime = endTime
+    self.roundTripSec = roundTripSec
+    self.numQueries = 0
+    self.numItems = 0
+    self._countersLock = threading.Lock()
+
+    self._timestamps = []
+    timestamp = startTime
+    while timestamp <= endTime:
+      self._timestamps.append(timestamp.strftime("%Y-%m-%dT%H:%M:%S"))
+      timestamp += datetime.timedelta(minutes=5)
+
+
+  def query_2(self, uid__eq, timestamp__gte):  # pylint: disable=C0103
+    endTimestamp = self.endTime.strftime("%Y-%m-%dT%H:%M:%S")
+    timestamps = self._timestamps[
+      bisect.bisect_left(self._timestamps, timestamp__gte):
+      bisect.bisect_right(self._timestamps, endTimestamp)]
+
+    with self._countersLock:
+      self.numQueries += 1
+      self.numItems += len(timestamps)
+
+    for i, timestamp in enumerate(timestamps):
+      if i % _ITEMS_PER_PAGE == 0:
+        time.sleep(self.roundTripSec)
+      yield {"uid": uid__eq,
+             "timestamp": timestamp,
+             "metric_value": 1.0 + (i % 7)}
+
+
+
+def _runCheck(confPath, models, table, extraArgs):
+  cliArgs = ["--monitorConfPath", confPath,
+             "--metricDataTable", "taurus.metric_data.test"] + extraArgs
+
+  with patch_helpers.patchCLIArgs("taurus-model-latency-monitor", *cliArgs), \
+      patch.object(model_latency_monitor.requests, "get", autospec=True,
+                   return_value=Mock(status_code=200,
+                                     json=Mock(return_value=models))), \
+      patch.object(model_latency_monitor, "Table", return_value=table), \
+      patch.object(model_latency_monitor.boto, "dynamodb2"), \
+      patch.object(model_latency_monitor, "isOutsideMarketHours",
+                   return_value=False):
+    checker = model_latency_monitor.ModelLatencyChecker()
+
+    table.numQueries = table.numItems = 0
+    start = time.time()
+    checker.checkAllModelLatency()
+    return time.time() - start
+
+
+
+def _parseArgs():
+  parser = OptionParser(usage="%prog [options]\n\n" + __doc__.strip())
+  parser.add_option("--models", dest="numModels", type="int", default=2000,
+                    help="number of models [default: %default]")
+  parser.add_option("--days", dest="days", type="int",
+                    default=model_latency_monitor.FIXED_WINDOW,
+                    help="window of samples [default: %default]")
+  parser.add_option("--round-trip-ms", dest="roundTripMs", type="float",
+                    default=20,
+                    help="simulated latency per page of query results "
+                         "[default: %default]")
+  parser.add_option("--concurrency", dest="concurrency", type="int",
+                    default=model_latency_monitor.CONCURRENCY,
+                    help="concurrent queries [default: %default]")
+
+  options, _ = parser.parse_args()
+  return vars(options)
+
+
+
+def main(numModels, days, roundTripMs, concurrency):
+  tempDir = tempfile.mkdtemp()
+  try:
+    confPath = os.path.join(tempDir, "monitor.conf")
+    with open(confPath, "w") as fileObj:
+      fileObj.write(_MONITOR_CONF)
+
+    summaryPath = os.path.join(tempDir, "summaries.json")
+
+    models = [{"uid": "%032x" % (i,), "name": "XIGNITE.SYM%d.VOLUME" % (i,)}
+              for i in xrange(numModels)]
+
+    # The monitor runs every 10 minutes; the table's samples end at the time
+    # of the run
+    secondNow = datetime.datetime.now(_UTC_TZ).replace(microsecond=0)
+    firstNow = secondNow - datetime.timedelta(minutes=10)
+
+    table = _FakeMetricDataTable(startTime=firstNow - datetime.timedelta(
+                                   days=days + 1),
+                                 endTime=secondNow,
+                                 roundTripSec=roundTripMs / 1000.0)
+
+    print "%d models; %d days of 5-minute samples; %gms per page" % (
+      numModels, days, roundTripMs)
+
+    duration = _runCheck(confPath, models, table,
+                         ["--days", str(days), "--concurrency", "1"])
+    print ("former (sequential, full window): %.2fs; %d queries; "
+           "%d items") % (duration, table.numQueries, table.numItems)
+
+    table.endTime = firstNow
+    duration = _runCheck(confPath, models, table,
+                         ["--days", str(days),
+                          "--concurrency", str(concurrency),
+                          "--intervalSummaryPath", summaryPath])
+    print ("first run with summaries (concurrency=%d): %.2fs; %d queries; "
+           "%d items") % (concurrency, duration, table.numQueries,
+                          table.numItems)
+
+    table.endTime = secondNow
+    duration = _runCheck(confPath, models, table,
+                         ["--days", str(days),
+                          "--concurrency", str(concurrency),
+                          "--intervalSummaryPath", summaryPath])
+    print ("next run with summaries (concurrency=%d): %.2fs; %d queries; "
+           "%d items") % (concurrency, duration, table.numQueries,
+                          table.numItems)
+  finally:
+    shutil.rmtree(tempDir)
+
+
+
+if __name__ == "__main__":
+  main(**_parseArgs())
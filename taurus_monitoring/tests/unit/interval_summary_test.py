@@ -0,0 +1,133 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+"""
+Unittest of taurus_monitoring/latency_monitor/interval_summary.py
+"""
+import datetime
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import numpy
+import pytz
+
+from taurus_monitoring.latency_monitor.interval_summary import (
+  IntervalSummary,
+  loadSummaries,
+  saveSummaries
+)
+
+
+
+_UTC_TZ = pytz.timezone("UTC")
+
+
+
+class IntervalSummaryTest(unittest.TestCase):
+
+
+  def setUp(self):
+    rng = random.Random(42)
+    start = _UTC_TZ.localize(datetime.datetime(2015, 11, 1, 0, 0, 0))
+    self.timestamps = [start]
+    for _ in xrange(2000):
+      self.timestamps.append(
+        self.timestamps[-1] + datetime.timedelta(seconds=rng.randint(60, 900)))
+
+
+  def testIncrementalStatsMatchBatchStats(self):
+    summary = IntervalSummary()
+
+    # Feed the samples in several increments, overlapping like successive
+    # queries with an inclusive lower bound
+    for i in xrange(0, len(self.timestamps), 300):
+      for timestamp in self.timestamps[max(0, i - 1):i + 300]:
+        summary.addSample(timestamp)
+
+    intervals = [(b - a).total_seconds()
+                 for a, b in zip(self.timestamps, self.timestamps[1:])]
+
+    count, mean, stddev = summary.getStats()
+    self.assertEqual(count, len(intervals))
+    self.assertAlmostEqual(mean, numpy.mean(intervals))
+    self.assertAlmostEqual(stddev, numpy.std(intervals))
+    self.assertEqual(summary.lastTimestamp, self.timestamps[-1])
+
+
+  def testEvictBefore(self):
+    summary = IntervalSummary()
+    for timestamp in self.timestamps:
+      summary.addSample(timestamp)
+
+    cutoff = self.timestamps[1000].date()
+    summary.evictBefore(cutoff)
+
+    intervals = [(b - a).total_seconds()
+                 for a, b in zip(self.timestamps, self.timestamps[1:])
+                 if b.date() >= cutoff]
+
+    count, mean, stddev = summary.getStats()
+    self.assertEqual(count, len(intervals))
+    self.assertAlmostEqual(mean, numpy.mean(intervals))
+    self.assertAlmostEqual(stddev, numpy.std(intervals))
+
+
+  def testNoIntervals(self):
+    summary = IntervalSummary()
+    self.assertEqual(summary.getStats(), (0, None, None))
+
+    summary.addSample(self.timestamps[0])
+    self.assertEqual(summary.getStats(), (0, None, None))
+
+
+  def testSaveAndLoadSummaries(self):
+    tempDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tempDir)
+    path = os.path.join(tempDir, "summaries.json")
+
+    self.assertEqual(loadSummaries(path), {})
+
+    summary = IntervalSummary()
+    for timestamp in self.timestamps:
+      summary.addSample(timestamp)
+
+    saveSummaries(path, {"uid1": summary, "uid2": IntervalSummary()})
+
+    loaded = loadSummaries(path)
+    self.assertItemsEqual(loaded.keys(), ["uid1", "uid2"])
+    self.assertEqual(loaded["uid1"].lastTimestamp, summary.lastTimestamp)
+    self.assertEqual(loaded["uid1"].getStats(), summary.getStats())
+    self.assertEqual(loaded["uid2"].getStats(), (0, None, None))
+    self.assertEqual(os.listdir(tempDir), ["summaries.json"])
+
+    # A corrupt file is discarded
+    with open(path, "w") as fileObj:
+      fileObj.write("{")
+    self.assertEqual(loadSummaries(path), {})
+
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -25,6 +25,8 @@ Unittest of taurus_monitoring/latency_monitor/model_latency_monitor.py
 import datetime
 from mock import Mock, patch
 import pickle
+import shutil
+import tempfile
 import unittest
 import os
 
@@ -35,6 +37,7 @@ from nta.utils.test_utils import patch_helpers
 from taurus_monitoring.latency_monitor.model_latency_monitor import (
   isOutsideMarketHours,
   LatencyMonitorError,
+  loadMarketHolidays,
   main,
   ModelLatencyChecker
 )
@@ -226,6 +229,82 @@ class ModelLatencyCheckerTest(unittest.TestCase):
           self.fail("Dynamodb was queried for a stock model after hours")
 
 
+  # Prevent Taurus HTTP API calls
+  @patch("requests.get", autospec=True)
+  # Prevent boto dynamodb API calls
+  @patch("boto.dynamodb2", autospec=True)
+  @patch("taurus_monitoring.latency_monitor.model_latency_monitor.Table",
+         autospec=True)
+  # Fix datetime.datetime.now() to known time relative to cached metric data
+  @patch_helpers.patchNow(
+    pytz.timezone("UTC").localize(
+      datetime.datetime(2015, 11, 2, 20, 41, 0, 0)))
+  # Disable pylint warning re: unused botoDynamoDB2Mock argument
+  # pylint: disable=W0613
+  def testIncrementalCheckQueriesOnlyNewSamples(self, tableMock,
+      botoDynamoDB2Mock, requestsGetMock):
+    tempDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tempDir)
+    summaryPath = os.path.join(tempDir, "summaries.json")
+
+    requestsGetMock.return_value = Mock(status_code=200,
+                                        json=Mock(return_value=MODELS))
+
+    # Emulate DynamoDB's range condition on the sample timestamps
+    # Disable pylint warning about improperly named arguments
+    # pylint: disable=C0103
+    def query2SideEffect(uid__eq, timestamp__gte):
+      return [sample for sample in METRIC_DATA_BY_ID[uid__eq]
+              if sample["timestamp"] >= timestamp__gte]
+
+    tableMock.return_value = (
+      Mock(query_2=Mock(side_effect=query2SideEffect,
+                        __name__=str(id(query2SideEffect))))
+    )
+
+    def checkAllModelLatency():
+      with patch_helpers.patchCLIArgs("taurus-model-latency-monitor",
+                                      "--monitorConfPath",
+                                      _TEST_CONF_FILEPATH,
+                                      "--metricDataTable",
+                                      "taurus.metric_data.test",
+                                      "--intervalSummaryPath",
+                                      summaryPath):
+        with self.assertRaises(LatencyMonitorError) as exc:
+          ModelLatencyChecker().checkAllModelLatency()
+      return exc.exception.message
+
+    firstMessage = checkAllModelLatency()
+    self.assertTrue(os.path.exists(summaryPath))
+
+    tableMock.return_value.query_2.reset_mock()
+
+    # The second run only queries samples since the last ones seen by the first
+    # run and arrives at the same thresholds
+    self.assertEqual(checkAllModelLatency(), firstMessage)
+
+    lastTimestamps = dict(
+      (uid, max(sample["timestamp"] for sample in samples
+                if sample["metric_value"]))
+      for uid, samples in METRIC_DATA_BY_ID.iteritems())
+    self.assertItemsEqual(
+      [(kwargs["uid__eq"], kwargs["timestamp__gte"])
+       for (_, kwargs) in tableMock.return_value.query_2.call_args_list],
+      lastTimestamps.items())
+
+
+  def testMarketHolidaysAreLoadedFromData(self):
+    holidays = loadMarketHolidays()
+    self.assertIn(datetime.date(2015, 12, 25), holidays)
+
+    # Noon in New York on a Wednesday
+    utcnow = pytz.timezone("UTC").localize(
+      datetime.datetime(2015, 12, 2, 17, 0, 0))
+    self.assertFalse(isOutsideMarketHours(utcnow, holidays))
+    self.assertTrue(
+      isOutsideMarketHours(utcnow, holidays | set([datetime.date(2015, 12, 2)])))
+
+
   # Mock command line arguments, specifying test config file and bogus
   # metric data table name
   @patch_helpers.patchCLIArgs("taurus-model-latency-monitor",
@@ -34,13 +34,21 @@ released)
 
 """
 from argparse import ArgumentParser
+from collections import deque
 import csv
 import json
+import cPickle as pickle
+import errno
 import logging
 import os
 import pkg_resources
+import shutil
+import struct
 import sys
+import tempfile
+import time
 import traceback
+import zlib
 
 import validictory
 
@@ -57,6 +65,23 @@ from unicorn_backend.utils import na
 g_log = logging.getLogger(__name__)
 
 
+# Number of bytes requested per read of the input in throughput mode
+_THROUGHPUT_INPUT_CHUNK_SIZE = 65536
+
+# Default bounds on the results that are buffered in throughput mode before
+# being flushed: number of results and seconds since the oldest one was
+# buffered
+_DEFAULT_FLUSH_ROWS = 1000
+_DEFAULT_FLUSH_LATENCY_MS = 250
+
+# Header of each frame in throughput mode output: the byte length of the JSON
+# payload that follows as unsigned 32-bit big-endian integer
+_FRAME_HEADER = struct.Struct(">I")
+
+# Default number of input rows between replay checkpoints
+_DEFAULT_CHECKPOINT_INTERVAL = 10000
+
+
 
 class _CommandLineArgError(Exception):
   """ Error parsing command-line options """
@@ -64,20 +89,47 @@ class _CommandLineArgError(Exception):
 
 
 
+class _ReplayCheckpointMismatch(Exception):
+  """ The replay checkpoint doesn't match the options or input of the run """
+  pass
+
+
+
 class _Options(object):
   """Options returned by _parseArgs"""
 
 
-  def __init__(self, inputSpec, aggSpec, modelSpec):
+  def __init__(self, inputSpec, aggSpec, modelSpec, throughput=False,
+               flushRows=_DEFAULT_FLUSH_ROWS,
+               flushLatencyMs=_DEFAULT_FLUSH_LATENCY_MS,
+               checkpointDir=None,
+               checkpointInterval=_DEFAULT_CHECKPOINT_INTERVAL,
+               resume=False):
     """
     :param dict inputSpec: Input data specification per input_opt_schema.json
     :param dict aggSpec: Optional aggregation specification per
       agg_otp_schema.json or None if no aggregation is requested
     :param dict modelSpec: Model specification per model_opt_schema.json
+    :param bool throughput: True to read the input in large chunks and emit
+      results in length-prefixed frames; see _FramedResultWriter
+    :param int flushRows: throughput mode: maximum number of buffered results
+    :param int flushLatencyMs: throughput mode: maximum milliseconds that a
+      result is buffered while the model keeps processing input
+    :param str checkpointDir: directory of the replay checkpoints of the input
+      file; None to not checkpoint
+    :param int checkpointInterval: number of input rows between checkpoints
+    :param bool resume: True to resume from the latest checkpoint in
+      checkpointDir, if any
     """
     self.inputSpec = inputSpec
     self.aggSpec = aggSpec
     self.modelSpec = modelSpec
+    self.throughput = throughput
+    self.flushRows = flushRows
+    self.flushLatencyMs = flushLatencyMs
+    self.checkpointDir = checkpointDir
+    self.checkpointInterval = checkpointInterval
+    self.resume = resume
 
 
 def _parseArgs():
@@ -120,8 +172,80 @@ def _parseArgs():
     help=("REQUIRED: JSON object describing the model per "
           "model_opt_schema.json."))
 
+  parser.add_argument(
+    "--throughput",
+    action="store_true",
+    dest="throughput",
+    default=False,
+    help=("OPTIONAL: read the input in large chunks and emit results in "
+          "batches, each a 4-byte big-endian payload length followed by a JSON "
+          "array of [timestamp, value, anomalyProbability] results, instead of "
+          "a JSON line per result; for bulk replays of input files."))
+
+  parser.add_argument(
+    "--flushRows",
+    type=int,
+    dest="flushRows",
+    default=_DEFAULT_FLUSH_ROWS,
+    help=("OPTIONAL: with --throughput, emit a batch at the latest when this "
+          "many results are buffered [default: %(default)s]."))
+
+  parser.add_argument(
+    "--flushLatencyMs",
+    type=int,
+    dest="flushLatencyMs",
+    default=_DEFAULT_FLUSH_LATENCY_MS,
+    help=("OPTIONAL: with --throughput, emit a batch at the latest when the "
+          "oldest buffered result is this many milliseconds old; buffered "
+          "results are also emitted whenever the runner waits for input "
+          "[default: %(default)s]."))
+
+  parser.add_argument(
+    "--checkpointDir",
+    type=str,
+    dest="checkpointDir",
+    default=None,
+    help=("OPTIONAL: directory in which to periodically checkpoint the replay "
+          "of the input csv file: the model, anomaly likelihood and "
+          "aggregation state and the number of input rows consumed; requires "
+          "csv in --input."))
+
+  parser.add_argument(
+    "--checkpointInterval",
+    type=int,
+    dest="checkpointInterval",
+    default=_DEFAULT_CHECKPOINT_INTERVAL,
+    help=("OPTIONAL: with --checkpointDir, number of input rows between "
+          "checkpoints [default: %(default)s]."))
+
+  parser.add_argument(
+    "--resume",
+    action="store_true",
+    dest="resume",
+    default=False,
+    help=("OPTIONAL: with --checkpointDir, resume the replay from the latest "
+          "checkpoint, if any, emitting the results that follow the ones "
+          "emitted before the checkpoint; the options must be the same as "
+          "those of the checkpointed run."))
+
   options = parser.parse_args()
 
+  if options.flushRows < 1:
+    parser.error("--flushRows must be positive, but got {}"
+                 .format(options.flushRows))
+
+  if options.flushLatencyMs < 0:
+    parser.error("--flushLatencyMs must not be negative, but got {}"
+                 .format(options.flushLatencyMs))
+
+
+  if options.checkpointInterval < 1:
+    parser.error("--checkpointInterval must be positive, but got {}"
+                 .format(options.checkpointInterval))
+
+  if options.resume and options.checkpointDir is None:
+    parser.error("--resume requires --checkpointDir")
+
 
   # Input spec is required
   try:
@@ -139,6 +263,9 @@ def _parseArgs():
       parser.error("JSON schema validation of --input value failed: {}"
                    .format(exc))
 
+  if options.checkpointDir is not None and "csv" not in inputSpec:
+    parser.error("--checkpointDir requires csv in --input")
+
 
   # Aggregation spec is optional
   aggSpec = options.aggSpec
@@ -176,7 +303,15 @@ def _parseArgs():
                    .format(exc))
 
 
-  return _Options(inputSpec=inputSpec, aggSpec=aggSpec, modelSpec=modelSpec)
+  return _Options(inputSpec=inputSpec,
+                  aggSpec=aggSpec,
+                  modelSpec=modelSpec,
+                  throughput=options.throughput,
+                  flushRows=options.flushRows,
+                  flushLatencyMs=options.flushLatencyMs,
+                  checkpointDir=options.checkpointDir,
+                  checkpointInterval=options.checkpointInterval,
+                  resume=options.resume)
 
 
 
@@ -186,13 +321,27 @@ class _ModelRunner(object):
   """
 
 
-  def __init__(self, inputFileObj, inputSpec, aggSpec, modelSpec):
+  def __init__(self, inputFileObj, inputSpec, aggSpec, modelSpec,
+               resultWriter=None, checkpointStore=None,
+               checkpointInterval=_DEFAULT_CHECKPOINT_INTERVAL, resume=False):
     """
-    :param inputFileObj: A file-like object that contains input metric data
+    :param inputFileObj: A file-like object that contains input metric data;
+      None if the input rows are passed to `processInputRow()` instead of
+      calling `run()`
     :param dict inputSpec: Input data specification per input_opt_schema.json
     :param dict aggSpec: Optional aggregation specification per
       agg_opt_schema.json or None if no aggregation is requested
     :param dict modelSpec: Model specification per model_opt_schema.json
+    :param resultWriter: _LineResultWriter or _FramedResultWriter that emits
+      the results; defaults to _LineResultWriter on stdout
+    :param checkpointStore: _ReplayCheckpointStore to checkpoint the replay in
+      every `checkpointInterval` input rows; None to not checkpoint
+    :param int checkpointInterval: number of input rows between checkpoints
+    :param bool resume: True to resume from the latest checkpoint in
+      checkpointStore, if any; the input must be the same as that of the
+      checkpointed run, and is consumed from the start
+    :raises _ReplayCheckpointMismatch: if resuming from a checkpoint of a run
+      with different specifications
     """
     self._inputSpec = inputSpec
 
@@ -226,11 +375,45 @@ class _ModelRunner(object):
     self._modelRecordEncoder = record_stream.ModelRecordEncoder(
       fields=inputRecordSchema)
 
-    self._model = self._createModel(modelSpec=modelSpec)
+    self._checkpointStore = checkpointStore
+    self._checkpointInterval = checkpointInterval
+
+    # Number of input rows consumed, including skipped ones, their CRC-32
+    # checksum, and number of results emitted; including those before the
+    # checkpoint this run resumed from, if any
+    self._numInputRows = 0
+    self._inputChecksum = 0
+    self._numResults = 0
 
-    self._anomalyLikelihood = AnomalyLikelihood()
+    checkpoint = checkpointStore.load() if resume else None
+
+    if checkpoint is None:
+      self._model = self._createModel(modelSpec=modelSpec)
+
+      self._anomalyLikelihood = AnomalyLikelihood()
+    else:
+      self._restoreCheckpoint(*checkpoint)
 
-    self._csvReader = self._createCsvReader(inputFileObj)
+    # Input rows consumed before the checkpoint this run resumed from that are
+    # yet to be consumed again, and the CRC-32 checksum of those consumed
+    self._numResumedInputRowsLeft = self._numInputRows
+    self._resumedInputChecksum = 0
+
+    self._numInputRowsAtCheckpoint = self._numInputRows
+
+    self._numRowsToSkip = max(inputSpec["rowOffset"] - self._numInputRows, 0)
+
+    self._parseDatetime = date_time_utils.createDatetimeParser(
+      inputSpec["datetimeFormat"])
+
+    if inputFileObj is not None:
+      self._csvReader = self._createCsvReader(inputFileObj)
+    else:
+      self._csvReader = None
+
+    if resultWriter is None:
+      resultWriter = _LineResultWriter(sys.stdout)
+    self._resultWriter = resultWriter
 
 
   @staticmethod
@@ -249,6 +432,60 @@ class _ModelRunner(object):
     return model
 
 
+  def _getSpecs(self):
+    """ Specifications of the run that a checkpoint is valid for """
+    return dict(inputSpec=self._inputSpec,
+                aggSpec=self._aggSpec,
+                modelSpec=self._modelSpec)
+
+
+  def _saveCheckpoint(self):
+    """ Checkpoint the replay after the input rows consumed so far """
+    # Results must not remain buffered, so that a run that resumes from this
+    # checkpoint emits exactly the ones that follow them
+    self._resultWriter.flush()
+
+    self._checkpointStore.save(
+      model=self._model,
+      state=dict(
+        specs=self._getSpecs(),
+        numInputRows=self._numInputRows,
+        inputChecksum=self._inputChecksum,
+        numResults=self._numResults,
+        aggregator=self._aggregator,
+        modelRecordEncoder=self._modelRecordEncoder,
+        anomalyLikelihood=self._anomalyLikelihood))
+
+    g_log.info("Checkpointed model=%s after numInputRows=%s, numResults=%s",
+               self._modelId, self._numInputRows, self._numResults)
+
+
+  def _restoreCheckpoint(self, model, state):
+    """ Restore the replay state from a checkpoint
+
+    :param model: OPF model loaded from the checkpoint
+    :param dict state: replay state saved with the checkpoint
+
+    :raises _ReplayCheckpointMismatch: if the checkpoint is of a run with
+      different specifications
+    """
+    if state["specs"] != self._getSpecs():
+      raise _ReplayCheckpointMismatch(
+        "Checkpoint of model={} was made with different input, aggregation or "
+        "model specifications: {}".format(self._modelId, state["specs"]))
+
+    self._model = model
+    self._anomalyLikelihood = state["anomalyLikelihood"]
+    self._aggregator = state["aggregator"]
+    self._modelRecordEncoder = state["modelRecordEncoder"]
+    self._numInputRows = state["numInputRows"]
+    self._inputChecksum = state["inputChecksum"]
+    self._numResults = state["numResults"]
+
+    g_log.info("Resuming model=%s after numInputRows=%s, numResults=%s",
+               self._modelId, self._numInputRows, self._numResults)
+
+
   @staticmethod
   def _createCsvReader(fileObj):
     # We'll be operating on csvs with arbitrarily long fields
@@ -260,22 +497,16 @@ class _ModelRunner(object):
     return csv.reader(fileObj, dialect="excel")
 
 
-  @classmethod
-  def _emitOutputMessage(cls, dataRow, anomalyProbability):
-    """Emit output message to stdout
+  def _emitOutputMessage(self, dataRow, anomalyProbability):
+    """Emit output message via the result writer
 
     :param list dataRow: the two-tuple data row on which anomalyProbability was
       computed, whose first element is datetime timestamp and second element is
       the float scalar value
     :param float anomalyProbability: computed anomaly probability value
     """
-
-    message = "%s\n" % (json.dumps([dataRow[0].isoformat(),
-                                    dataRow[1],
-                                    anomalyProbability]),)
-
-    sys.stdout.write(message)
-    sys.stdout.flush()
+    self._resultWriter.write(dataRow[0], dataRow[1], anomalyProbability)
+    self._numResults += 1
 
 
   def _computeAnomalyProbability(self, fields):
@@ -304,45 +535,83 @@ class _ModelRunner(object):
     """ Run the model: ingest and process the input metric data and emit output
     messages containing anomaly scores
     """
-
-    numRowsToSkip = self._inputSpec["rowOffset"]
-    datetimeFormat = self._inputSpec["datetimeFormat"]
-    inputRowTimestampIndex = self._inputSpec["timestampIndex"]
-    inputRowValueIndex = self._inputSpec["valueIndex"]
-
     g_log.info("Processing model=%s", self._modelId)
 
     for inputRow in self._csvReader:
-      g_log.debug("Got inputRow=%r", inputRow)
-
-      if numRowsToSkip > 0:
-        numRowsToSkip -= 1
-        g_log.debug("Skipping header row %s; %s rows left to skip",
-                    inputRow, numRowsToSkip)
-        continue
-      
-      if len(inputRow) > inputRowValueIndex:
-        if not (na.isNA(str(inputRow[inputRowValueIndex])) or
-         na.isNA(str(inputRow[inputRowTimestampIndex]))):
-          # Extract timestamp and value
-          # NOTE: the order must match the `inputFields` that we passed to the
-          # Aggregator constructor
-  
-          fields = [
-            date_time_utils.parseDatetime(inputRow[inputRowTimestampIndex],
-                                          datetimeFormat),
-            float(inputRow[inputRowValueIndex])
-          ]
-  
-          # Aggregate
-          aggRow, _ = self._aggregator.next(fields, None)
-          g_log.debug("Aggregator returned %s for %s", aggRow, fields)
-          if aggRow is not None:
-            self._emitOutputMessage(
-              dataRow=aggRow,
-              anomalyProbability=self._computeAnomalyProbability(aggRow))
+      self.processInputRow(inputRow)
+
+    self.finish()
 
 
+  def processInputRow(self, inputRow):
+    """ Process an input row: aggregate it and emit the anomaly score of the
+    aggregated row, if one is complete
+
+    :param list inputRow: fields of the input CSV row
+    """
+    if self._numResumedInputRowsLeft > 0:
+      # Consumed before the checkpoint this run resumed from
+      self._numResumedInputRowsLeft -= 1
+      self._resumedInputChecksum = zlib.crc32("\0".join(inputRow),
+                                              self._resumedInputChecksum)
+      if (self._numResumedInputRowsLeft == 0 and
+          self._resumedInputChecksum != self._inputChecksum):
+        raise _ReplayCheckpointMismatch(
+          "The first {} input rows of model={} differ from those that were "
+          "checkpointed".format(self._numInputRows, self._modelId))
+      return
+
+    if (self._checkpointStore is not None and
+        self._numInputRows - self._numInputRowsAtCheckpoint >=
+        self._checkpointInterval):
+      self._saveCheckpoint()
+      self._numInputRowsAtCheckpoint = self._numInputRows
+
+    self._numInputRows += 1
+    self._inputChecksum = zlib.crc32("\0".join(inputRow), self._inputChecksum)
+
+    g_log.debug("Got inputRow=%r", inputRow)
+
+    if self._numRowsToSkip > 0:
+      self._numRowsToSkip -= 1
+      g_log.debug("Skipping header row %s; %s rows left to skip",
+                  inputRow, self._numRowsToSkip)
+      return
+
+    inputRowTimestampIndex = self._inputSpec["timestampIndex"]
+    inputRowValueIndex = self._inputSpec["valueIndex"]
+
+    if len(inputRow) > inputRowValueIndex:
+      if not (na.isNA(str(inputRow[inputRowValueIndex])) or
+       na.isNA(str(inputRow[inputRowTimestampIndex]))):
+        # Extract timestamp and value
+        # NOTE: the order must match the `inputFields` that we passed to the
+        # Aggregator constructor
+
+        fields = [
+          self._parseDatetime(inputRow[inputRowTimestampIndex]),
+          float(inputRow[inputRowValueIndex])
+        ]
+
+        # Aggregate
+        aggRow, _ = self._aggregator.next(fields, None)
+        g_log.debug("Aggregator returned %s for %s", aggRow, fields)
+        if aggRow is not None:
+          self._emitOutputMessage(
+            dataRow=aggRow,
+            anomalyProbability=self._computeAnomalyProbability(aggRow))
+
+
+  def finish(self):
+    """ Process the end of the input: emit the anomaly score of the remaining
+    aggregated row, if any, and flush the results
+    """
+    if self._numResumedInputRowsLeft > 0:
+      raise _ReplayCheckpointMismatch(
+        "Input of model={} ended {} rows before the checkpointed row {}"
+        .format(self._modelId, self._numResumedInputRowsLeft,
+                self._numInputRows))
+
     # Reap remaining data from aggregator
     aggRow, _ = self._aggregator.next(None, curInputBookmark=None)
     g_log.debug("Aggregator reaped %s in final call", aggRow)
@@ -351,6 +620,324 @@ class _ModelRunner(object):
         dataRow=aggRow,
         anomalyProbability=self._computeAnomalyProbability(aggRow))
 
+    self._resultWriter.flush()
+
+
+class _ReplayCheckpointStore(object):
+  """ Keeps the latest checkpoint of the replay of an input file by a model
+  runner in a directory:
+
+  <checkpointDir>/
+    checkpoint_0000000007/ (sequence number of the checkpoint)
+      model/ (saved by the OPF model)
+      runner_state.pkl (pickled state of the runner)
+    .tmp_*/ (checkpoint being saved; removed by the next run)
+
+  A checkpoint is saved in a temporary directory and renamed into place once
+  complete, so a crash leaves the previous checkpoint intact. Older checkpoints
+  are removed after a new one is in place.
+  """
+
+  _CHECKPOINT_DIR_NAME_PREFIX = "checkpoint_"
+
+  _TEMP_DIR_NAME_PREFIX = ".tmp_"
+
+  _MODEL_DIR_NAME = "model"
+
+  _STATE_FILE_NAME = "runner_state.pkl"
+
+
+  def __init__(self, checkpointDir):
+    """
+    :param str checkpointDir: directory of the checkpoints; created if missing
+    """
+    self._checkpointDir = checkpointDir
+
+    try:
+      os.makedirs(checkpointDir)
+    except OSError as exc:
+      if exc.errno != errno.EEXIST:
+        raise
+
+    # Remove checkpoints that were interrupted while being saved
+    for name in os.listdir(checkpointDir):
+      if name.startswith(self._TEMP_DIR_NAME_PREFIX):
+        shutil.rmtree(os.path.join(checkpointDir, name))
+
+
+  def _getCheckpointSequenceNumbers(self):
+    """
+    :returns: sorted sequence numbers of the complete checkpoints
+    """
+    prefix = self._CHECKPOINT_DIR_NAME_PREFIX
+    return sorted(int(name[len(prefix):])
+                  for name in os.listdir(self._checkpointDir)
+                  if name.startswith(prefix))
+
+
+  def _getCheckpointPath(self, sequenceNumber):
+    return os.path.join(self._checkpointDir,
+                        "%s%010d" % (self._CHECKPOINT_DIR_NAME_PREFIX,
+                                     sequenceNumber))
+
+
+  @staticmethod
+  def _fsyncTree(rootPath):
+    """ Flush the files of the directory tree, and the directories where the
+    platform supports it, to disk
+    """
+    for parentPath, _dirNames, fileNames in os.walk(rootPath, topdown=False):
+      for fileName in fileNames:
+        fd = os.open(os.path.join(parentPath, fileName), os.O_RDONLY)
+        try:
+          os.fsync(fd)
+        finally:
+          os.close(fd)
+
+      if hasattr(os, "O_DIRECTORY"):
+        fd = os.open(parentPath, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+          os.fsync(fd)
+        finally:
+          os.close(fd)
+
+
+  def save(self, model, state):
+    """ Save a checkpoint and make it the latest one
+
+    :param model: OPF model
+    :param dict state: picklable runner state
+    """
+    sequenceNumbers = self._getCheckpointSequenceNumbers()
+
+    tempPath = tempfile.mkdtemp(prefix=self._TEMP_DIR_NAME_PREFIX,
+                                dir=self._checkpointDir)
+
+    model.save(saveModelDir=os.path.join(tempPath, self._MODEL_DIR_NAME))
+
+    with open(os.path.join(tempPath, self._STATE_FILE_NAME), "wb") as fileObj:
+      pickle.dump(state, fileObj, pickle.HIGHEST_PROTOCOL)
+
+    self._fsyncTree(tempPath)
+
+    os.rename(
+      tempPath,
+      self._getCheckpointPath(sequenceNumbers[-1] + 1 if sequenceNumbers
+                              else 0))
+
+    if hasattr(os, "O_DIRECTORY"):
+      fd = os.open(self._checkpointDir, os.O_RDONLY | os.O_DIRECTORY)
+      try:
+        os.fsync(fd)
+      finally:
+        os.close(fd)
+
+    for sequenceNumber in sequenceNumbers:
+      shutil.rmtree(self._getCheckpointPath(sequenceNumber))
+
+
+  def load(self):
+    """ Load the latest checkpoint
+
+    :returns: (model, state) of the latest checkpoint; None if there is none
+    """
+    sequenceNumbers = self._getCheckpointSequenceNumbers()
+    if not sequenceNumbers:
+      return None
+
+    checkpointPath = self._getCheckpointPath(sequenceNumbers[-1])
+
+    with open(os.path.join(checkpointPath, self._STATE_FILE_NAME),
+              "rb") as fileObj:
+      state = pickle.load(fileObj)
+
+    model = ModelFactory.loadFromCheckpoint(
+      os.path.join(checkpointPath, self._MODEL_DIR_NAME))
+
+    return model, state
+
+
+
+def _writeFrame(outputFileObj, payload):
+  """ Write a length-prefixed frame, _FRAME_HEADER with the byte length of the
+  payload followed by the payload, and flush it
+
+  :param outputFileObj: binary file-like object to write the frame to
+  :param str payload: payload of the frame
+  """
+  outputFileObj.write(_FRAME_HEADER.pack(len(payload)) + payload)
+  outputFileObj.flush()
+
+
+
+class _LineResultWriter(object):
+  """ Emits each result as a line with a JSON array
+  [<ISO timestamp>, <value>, <anomalyProbability>] and flushes it immediately
+  """
+
+
+  def __init__(self, outputFileObj):
+    """
+    :param outputFileObj: file-like object to write the results to
+    """
+    self._outputFileObj = outputFileObj
+
+
+  def write(self, timestamp, value, anomalyProbability):
+    """ Emit a result
+
+    :param datetime.datetime timestamp: timestamp of the data row
+    :param float value: value of the data row
+    :param float anomalyProbability: computed anomaly probability value
+    """
+    message = "%s\n" % (json.dumps([timestamp.isoformat(),
+                                    value,
+                                    anomalyProbability]),)
+
+    self._outputFileObj.write(message)
+    self._outputFileObj.flush()
+
+
+  def flush(self):
+    """ Nothing is buffered """
+    pass
+
+
+
+class _FramedResultWriter(object):
+  """ Buffers results and emits them in length-prefixed frames: _FRAME_HEADER
+  with the byte length of the payload, followed by the payload, a JSON array of
+  [<ISO timestamp>, <value>, <anomalyProbability>] results.
+
+  Buffered results are emitted as soon as `maxRows` of them accumulate or the
+  oldest of them was buffered `maxLatency` seconds before a result is written,
+  and on `flush()`; the caller should flush whenever it is about to wait for
+  input, so that results are delayed by at most `maxLatency` plus the time it
+  takes to compute one result.
+  """
+
+
+  def __init__(self, outputFileObj, maxRows, maxLatency):
+    """
+    :param outputFileObj: binary file-like object to write the frames to
+    :param int maxRows: maximum number of buffered results
+    :param float maxLatency: maximum seconds a result is buffered while results
+      are being written
+    """
+    self._outputFileObj = outputFileObj
+    self._maxRows = maxRows
+    self._maxLatency = maxLatency
+
+    self._results = []
+    self._oldestResultTime = None
+
+
+  def write(self, timestamp, value, anomalyProbability):
+    """ Buffer a result and emit the buffered results if a bound is reached
+
+    :param datetime.datetime timestamp: timestamp of the data row
+    :param float value: value of the data row
+    :param float anomalyProbability: computed anomaly probability value
+    """
+    now = time.time()
+    if not self._results:
+      self._oldestResultTime = now
+
+    self._results.append([timestamp.isoformat(), value, anomalyProbability])
+
+    if (len(self._results) >= self._maxRows or
+        now - self._oldestResultTime >= self._maxLatency):
+      self.flush()
+
+
+  def flush(self):
+    """ Emit the buffered results, if any, as a frame """
+    if not self._results:
+      return
+
+    _writeFrame(self._outputFileObj, self._encodePayload(self._results))
+
+    self._results = []
+
+
+  @staticmethod
+  def _encodePayload(results):
+    """ Encode the payload of a frame
+
+    :param list results: [<ISO timestamp>, <value>, <anomalyProbability>]
+      results
+    :returns: the JSON payload
+    """
+    return json.dumps(results, separators=(",", ":"))
+
+
+
+class _ChunkedLineIterInputFile(object):
+  """Enable line iteration from a file that reads the input in large chunks.
+
+  Like _UnbufferedLineIterInputFile, lines are returned as soon as they are
+  available without waiting to fill a buffer, but with a read system call per
+  chunk instead of one per line. Line endings are translated to "\n" as in
+  universal newlines mode.
+
+  If given, `beforeRead` is called before each read, which may block on
+  interactive input; e.g., to flush buffered results.
+  """
+
+
+  def __init__(self, fileObj, chunkSize=_THROUGHPUT_INPUT_CHUNK_SIZE,
+               beforeRead=None):
+    self.fileObj = fileObj
+    self._chunkSize = chunkSize
+    self._beforeRead = beforeRead
+
+    self._lines = deque()
+    self._partialLine = ""
+    self._eof = False
+
+
+  def __iter__(self):
+    return self
+
+
+  def next(self):
+    while not self._lines:
+      if self._eof:
+        raise StopIteration
+
+      self._readChunk()
+
+    return self._lines.popleft()
+
+
+  def _readChunk(self):
+    if self._beforeRead is not None:
+      self._beforeRead()
+
+    chunk = os.read(self.fileObj.fileno(), self._chunkSize)
+
+    if not chunk:
+      self._eof = True
+      if self._partialLine:
+        self._lines.append(self._partialLine.replace("\r", "\n"))
+        self._partialLine = ""
+      return
+
+    data = self._partialLine + chunk
+
+    # Hold back a trailing CR that may be the first half of a CRLF
+    heldBack = ""
+    if data.endswith("\r"):
+      data, heldBack = data[:-1], "\r"
+
+    lines = data.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    self._partialLine = lines.pop() + heldBack
+    self._lines.extend(line + "\n" for line in lines)
+
+
+  def __getattr__(self, attr):
+    return getattr(self.fileObj, attr)
+
 
 
 class _UnbufferedLineIterInputFile(object):
@@ -389,6 +976,17 @@ class _UnbufferedLineIterInputFile(object):
 
 
 
+def _openBinaryStdout():
+  """ Open a binary-mode file object for writing frames to stdout """
+  fd = os.dup(sys.stdout.fileno())
+  if sys.platform == "win32":
+    import msvcrt  # pylint: disable=F0401
+    msvcrt.setmode(fd, os.O_BINARY)  # pylint: disable=E1101
+
+  return os.fdopen(fd, "wb")
+
+
+
 def main():
   # Use NullHandler for now to avoid getting the unwanted unformatted warning
   # message from logger on stderr "No handlers could be found for logger".
@@ -398,24 +996,58 @@ def main():
   # `logging.debug`, `logging.info`, etc.
   g_log.root.addHandler(logging.NullHandler())
   inputFileObj = None
+  outputFileObj = None
+  resultWriter = None
   try:
     options = _parseArgs()
 
+    # In throughput mode, line endings are translated by
+    # _ChunkedLineIterInputFile
+    inputMode = "rb" if options.throughput else "rU"
+
     # Create an input file object with the desired properties
     if "csv" in options.inputSpec:
-      inputFileObj = open(options.inputSpec["csv"], mode="rU")
+      inputFileObj = open(options.inputSpec["csv"], mode=inputMode)
     else:
-      inputFileObj = os.fdopen(os.dup(sys.stdin.fileno()), "rU")
+      inputFileObj = os.fdopen(os.dup(sys.stdin.fileno()), inputMode)
+
+    if options.throughput:
+      outputFileObj = _openBinaryStdout()
+      resultWriter = _FramedResultWriter(
+        outputFileObj=outputFileObj,
+        maxRows=options.flushRows,
+        maxLatency=options.flushLatencyMs / 1000.0)
+      modelInputFileObj = _ChunkedLineIterInputFile(
+        inputFileObj,
+        beforeRead=resultWriter.flush)
+    else:
+      modelInputFileObj = inputFileObj
+
+    if options.checkpointDir is not None:
+      checkpointStore = _ReplayCheckpointStore(options.checkpointDir)
+    else:
+      checkpointStore = None
 
     # Invoke the model runner
     _ModelRunner(
-      inputFileObj=inputFileObj,
+      inputFileObj=modelInputFileObj,
       inputSpec=options.inputSpec,
       aggSpec=options.aggSpec,
-      modelSpec=options.modelSpec).run()
+      modelSpec=options.modelSpec,
+      resultWriter=resultWriter,
+      checkpointStore=checkpointStore,
+      checkpointInterval=options.checkpointInterval,
+      resume=options.resume).run()
   except Exception as ex:  # pylint: disable=W0703
     g_log.exception("ModelRunner failed")
 
+    if resultWriter is not None:
+      # Emit the results that were computed before the failure
+      try:
+        resultWriter.flush()
+      except Exception:  # pylint: disable=W0703
+        g_log.exception("Failed to emit buffered results")
+
     errorMessage = json.dumps({
       "errorText": str(ex) or repr(ex),
       "diagnosticInfo": traceback.format_exc()
@@ -439,6 +1071,9 @@ def main():
     if inputFileObj is not None:
       inputFileObj.close()
 
+    if outputFileObj is not None:
+      outputFileObj.close()
+
 
 
 if __name__ == "__main__":
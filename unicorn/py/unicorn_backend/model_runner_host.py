@@ -0,0 +1,636 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Implements a host process that runs many Unicorn models in one Python
+interpreter, each like a model_runner_2 process would, so that the models share
+the interpreter and the NuPIC modules instead of loading them once per model.
+
+Input and output are length-prefixed frames on stdin and stdout:
+model_runner_2._FRAME_HEADER with the byte length of the payload, followed by
+the payload, a JSON object.
+
+Input frames are commands:
+
+  {"command": "defineModel", "modelId": <id>, "input": <input spec>,
+   "agg": <aggregation spec or null>, "model": <model spec>}
+    Create a model; the specs are those of the --input, --agg and --model
+    options of model_runner_2, except that csv input is not supported
+
+  {"command": "rows", "modelId": <id>, "rows": [[<field>, ...], ...]}
+    Input rows of the model, each a list of the fields of a CSV row
+
+  {"command": "endInput", "modelId": <id>}
+    End of the input of the model: emit its remaining results and remove it
+
+  {"command": "removeModel", "modelId": <id>}
+    Remove the model, discarding input rows that weren't processed yet
+
+Output frames are tagged with the model ID:
+
+  {"modelId": <id>, "results": [[<ISO timestamp>, <value>,
+                                 <anomalyProbability>], ...]}
+
+  {"modelId": <id>, "end": true}
+    After the last results of a model whose input ended
+
+  {"modelId": <id>, "error": {"errorText": <text>, "diagnosticInfo": <text>}}
+    The model failed and was removed; the other models keep running
+
+Models with pending input rows are served round-robin, up to `quantum` rows per
+turn, so that a burst of rows for one model doesn't starve the others. Results
+are buffered per model like in the throughput mode of model_runner_2 and are
+emitted whenever the host is about to wait for input. End of stdin ends the
+input of all models.
+
+Errors that aren't specific to a model, such as a malformed frame, are fatal
+and are reported on stderr like model_runner_2 does.
+"""
+
+from argparse import ArgumentParser
+from collections import deque
+import json
+import logging
+import os
+import pkg_resources
+import Queue
+import sys
+import threading
+import traceback
+
+import validictory
+
+from unicorn_backend import model_runner_2
+
+
+
+g_log = logging.getLogger(__name__)
+
+
+# Default maximum number of input rows that a model processes per turn
+_DEFAULT_QUANTUM = 100
+
+# Maximum number of input frames that are read ahead of the scheduler; bounds
+# the memory taken by input rows that weren't processed yet
+_MAX_QUEUED_FRAMES = 100
+
+
+
+class _CommandLineArgError(Exception):
+  """ Error parsing command-line options """
+  pass
+
+
+
+class _ProtocolError(Exception):
+  """ Malformed input frame or command """
+  pass
+
+
+
+class _Options(object):
+  """Options returned by _parseArgs"""
+
+
+  def __init__(self, flushRows, flushLatencyMs, quantum):
+    """
+    :param int flushRows: maximum number of buffered results per model
+    :param int flushLatencyMs: maximum milliseconds that a result is buffered
+      while the model keeps processing input
+    :param int quantum: maximum number of input rows that a model processes
+      per turn
+    """
+    self.flushRows = flushRows
+    self.flushLatencyMs = flushLatencyMs
+    self.quantum = quantum
+
+
+
+def _parseArgs():
+  """ Parse command-line args
+
+  :rtype: _Options object
+  :raises _CommandLineArgError: on command-line arg error
+  """
+  class SilentArgumentParser(ArgumentParser):
+    def error(self, msg):
+      """Override `error()` to prevent unstructured output to stderr"""
+      raise _CommandLineArgError(msg)
+
+  parser = SilentArgumentParser(description=("Start Unicorn ModelRunner host "
+                                             "that runs many models."))
+
+  parser.add_argument(
+    "--flushRows",
+    type=int,
+    dest="flushRows",
+    default=model_runner_2._DEFAULT_FLUSH_ROWS,  # pylint: disable=W0212
+    help=("OPTIONAL: emit the results of a model at the latest when this many "
+          "of them are buffered [default: %(default)s]."))
+
+  parser.add_argument(
+    "--flushLatencyMs",
+    type=int,
+    dest="flushLatencyMs",
+    default=model_runner_2._DEFAULT_FLUSH_LATENCY_MS,  # pylint: disable=W0212
+    help=("OPTIONAL: emit the results of a model at the latest when the oldest "
+          "of them is this many milliseconds old; buffered results are also "
+          "emitted whenever the host waits for input [default: %(default)s]."))
+
+  parser.add_argument(
+    "--quantum",
+    type=int,
+    dest="quantum",
+    default=_DEFAULT_QUANTUM,
+    help=("OPTIONAL: maximum number of input rows that a model processes "
+          "before the next model with pending input rows is served "
+          "[default: %(default)s]."))
+
+  options = parser.parse_args()
+
+  if options.flushRows < 1:
+    parser.error("--flushRows must be positive, but got {}"
+                 .format(options.flushRows))
+
+  if options.flushLatencyMs < 0:
+    parser.error("--flushLatencyMs must not be negative, but got {}"
+                 .format(options.flushLatencyMs))
+
+  if options.quantum < 1:
+    parser.error("--quantum must be positive, but got {}"
+                 .format(options.quantum))
+
+  return _Options(flushRows=options.flushRows,
+                  flushLatencyMs=options.flushLatencyMs,
+                  quantum=options.quantum)
+
+
+
+def _readFrame(inputFileObj):
+  """ Read a length-prefixed frame
+
+  :param inputFileObj: binary file-like object to read the frame from
+  :returns: the payload of the frame; None at end of input
+  :raises _ProtocolError: if the input ends within a frame
+  """
+  # pylint: disable=W0212
+  header = inputFileObj.read(model_runner_2._FRAME_HEADER.size)
+  if not header:
+    return None
+
+  if len(header) < model_runner_2._FRAME_HEADER.size:
+    raise _ProtocolError("Input ended within a frame header")
+
+  (payloadLength,) = model_runner_2._FRAME_HEADER.unpack(header)
+  payload = inputFileObj.read(payloadLength)
+  if len(payload) < payloadLength:
+    raise _ProtocolError("Input ended within a frame of {} bytes after {} "
+                         "bytes".format(payloadLength, len(payload)))
+
+  return payload
+
+
+
+class _TaggedFramedResultWriter(model_runner_2._FramedResultWriter):
+  """ Buffers the results of a model and emits them in length-prefixed frames
+  like _FramedResultWriter, but with a payload that is tagged with the model
+  ID: {"modelId": <id>, "results": [[<ISO timestamp>, <value>,
+  <anomalyProbability>], ...]}
+  """
+
+
+  def __init__(self, outputFileObj, modelId, maxRows, maxLatency):
+    """
+    :param outputFileObj: binary file-like object to write the frames to
+    :param modelId: ID of the model whose results are written
+    :param int maxRows: maximum number of buffered results
+    :param float maxLatency: maximum seconds a result is buffered while results
+      are being written
+    """
+    super(_TaggedFramedResultWriter, self).__init__(outputFileObj,
+                                                    maxRows=maxRows,
+                                                    maxLatency=maxLatency)
+    self._modelId = modelId
+
+
+  def _encodePayload(self, results):
+    return json.dumps({"modelId": self._modelId, "results": results},
+                      separators=(",", ":"))
+
+
+
+class _HostedModel(object):
+  """ A model run by _ModelHost """
+
+
+  def __init__(self, modelId, runner, resultWriter):
+    """
+    :param modelId: ID of the model
+    :param model_runner_2._ModelRunner runner: runner of the model
+    :param _TaggedFramedResultWriter resultWriter: writer of the results of
+      the model
+    """
+    self.modelId = modelId
+    self.runner = runner
+    self.resultWriter = resultWriter
+
+    # Input rows that weren't processed yet
+    self.pendingRows = deque()
+
+    # True when no more input rows are expected
+    self.inputEnded = False
+
+    # True while the model is in the round-robin queue of the host
+    self.scheduled = False
+
+
+
+class _ModelHost(object):
+  """ Runs many models that are fed from a single stream of input frames and
+  emit their results to a single stream of output frames; see the module
+  docstring for the protocol
+  """
+
+
+  def __init__(self, inputFileObj, outputFileObj, flushRows, flushLatencyMs,
+               quantum, maxQueuedFrames=_MAX_QUEUED_FRAMES):
+    """
+    :param inputFileObj: binary file-like object to read the input frames from
+    :param outputFileObj: binary file-like object to write the output frames
+      to
+    :param int flushRows: maximum number of buffered results per model
+    :param int flushLatencyMs: maximum milliseconds that a result is buffered
+      while the model keeps processing input
+    :param int quantum: maximum number of input rows that a model processes
+      per turn
+    :param int maxQueuedFrames: maximum number of input frames that are read
+      ahead of the scheduler
+    """
+    self._inputFileObj = inputFileObj
+    self._outputFileObj = outputFileObj
+    self._flushRows = flushRows
+    self._flushLatency = flushLatencyMs / 1000.0
+    self._quantum = quantum
+    self._maxQueuedFrames = maxQueuedFrames
+
+    self._schemas = dict(
+      (name, self._loadSchema(name))
+      for name in ("input_opt_schema.json",
+                   "agg_opt_schema.json",
+                   "model_opt_schema.json"))
+
+    # Hosted models by model ID
+    self._models = {}
+
+    # Models with pending input rows or whose input ended, in the order they
+    # are served
+    self._readyModels = deque()
+
+    # Input frames read by the reader thread; None at end of input
+    self._frames = Queue.Queue(maxsize=maxQueuedFrames)
+    self._readerExcInfo = None
+    self._inputEnded = False
+
+    self._commandHandlers = {
+      "defineModel": self._defineModel,
+      "rows": self._addRows,
+      "endInput": self._endInput,
+      "removeModel": self._removeModel
+    }
+
+
+  @staticmethod
+  def _loadSchema(schemaName):
+    with pkg_resources.resource_stream(model_runner_2.__name__,
+                                       schemaName) as schemaFile:
+      return json.load(schemaFile)
+
+
+  def run(self):
+    """ Run the models until the end of the input and of the input of all
+    models
+    """
+    reader = threading.Thread(target=self._readFrames,
+                              name="ModelHostFrameReader")
+    reader.daemon = True
+    reader.start()
+
+    while not (self._inputEnded and not self._readyModels):
+      self._receiveCommands()
+      self._runRound()
+
+    self.flushResults()
+
+
+  def flushResults(self):
+    """ Emit the buffered results of all models """
+    for model in self._models.itervalues():
+      model.resultWriter.flush()
+
+
+  def _readFrames(self):
+    """ Reader thread: queue the input frames for the scheduler """
+    try:
+      while True:
+        payload = _readFrame(self._inputFileObj)
+        if payload is None:
+          break
+
+        self._frames.put(payload)
+    except Exception:  # pylint: disable=W0703
+      g_log.exception("Reading input frames failed")
+      self._readerExcInfo = sys.exc_info()
+    finally:
+      self._frames.put(None)
+
+
+  def _receiveCommands(self):
+    """ Dispatch the queued input frames; wait for one, after emitting the
+    buffered results, if no model is ready to run
+    """
+    block = not self._readyModels
+    if block:
+      self.flushResults()
+
+    for _ in xrange(self._maxQueuedFrames):
+      try:
+        payload = self._frames.get(block=block)
+      except Queue.Empty:
+        break
+
+      block = False
+
+      if payload is None:
+        if self._readerExcInfo is not None:
+          excType, excValue, excTraceback = self._readerExcInfo
+          raise excType, excValue, excTraceback
+
+        self._endAllInput()
+        break
+
+      self._dispatch(payload)
+
+
+  def _endAllInput(self):
+    self._inputEnded = True
+    for model in self._models.itervalues():
+      model.inputEnded = True
+      self._schedule(model)
+
+
+  def _dispatch(self, payload):
+    """ Execute the command of an input frame; a failure to execute a command
+    fails only the model the command is for
+
+    :param str payload: payload of the input frame
+    :raises _ProtocolError: if the payload isn't a valid command
+    """
+    try:
+      command = json.loads(payload)
+    except ValueError as exc:
+      raise _ProtocolError("Input frame failed JSON parsing: {}".format(exc))
+
+    if not isinstance(command, dict) or "modelId" not in command:
+      raise _ProtocolError("Input frame is not a command with a modelId: {!r}"
+                           .format(payload[:200]))
+
+    try:
+      handler = self._commandHandlers[command.get("command")]
+    except (KeyError, TypeError):
+      raise _ProtocolError("Unknown command in input frame: {!r}"
+                           .format(command.get("command")))
+
+    modelId = command["modelId"]
+    try:
+      handler(modelId, command)
+    except Exception:  # pylint: disable=W0703
+      self._failModel(modelId)
+
+
+  def _validateSpec(self, spec, schemaName, commandKey):
+    try:
+      validictory.validate(spec, self._schemas[schemaName])
+    except validictory.ValidationError as exc:
+      raise ValueError("JSON schema validation of {} failed: {}"
+                       .format(commandKey, exc))
+
+
+  def _defineModel(self, modelId, command):
+    if modelId in self._models:
+      raise ValueError("Model {} is already defined".format(modelId))
+
+    inputSpec = command.get("input")
+    aggSpec = command.get("agg")
+    modelSpec = command.get("model")
+
+    self._validateSpec(inputSpec, "input_opt_schema.json", "input")
+    if "csv" in inputSpec:
+      raise ValueError("csv input is not supported by the model runner host")
+
+    if aggSpec is not None:
+      self._validateSpec(aggSpec, "agg_opt_schema.json", "agg")
+
+    self._validateSpec(modelSpec, "model_opt_schema.json", "model")
+
+    resultWriter = _TaggedFramedResultWriter(self._outputFileObj,
+                                             modelId=modelId,
+                                             maxRows=self._flushRows,
+                                             maxLatency=self._flushLatency)
+
+    # pylint: disable=W0212
+    runner = model_runner_2._ModelRunner(inputFileObj=None,
+                                         inputSpec=inputSpec,
+                                         aggSpec=aggSpec,
+                                         modelSpec=modelSpec,
+                                         resultWriter=resultWriter)
+
+    self._models[modelId] = _HostedModel(modelId, runner, resultWriter)
+    g_log.info("Defined model=%s; %d models", modelId, len(self._models))
+
+
+  def _getModel(self, modelId):
+    try:
+      return self._models[modelId]
+    except KeyError:
+      raise ValueError("Model {} is not defined".format(modelId))
+
+
+  def _addRows(self, modelId, command):
+    model = self._getModel(modelId)
+    if model.inputEnded:
+      raise ValueError("Got rows for model {} after the end of its input"
+                       .format(modelId))
+
+    rows = command.get("rows")
+    if not isinstance(rows, list):
+      raise ValueError("Expected a list of rows for model {}, but got {!r}"
+                       .format(modelId, rows))
+
+    model.pendingRows.extend(rows)
+    self._schedule(model)
+
+
+  def _endInput(self, modelId, command):  # pylint: disable=W0613
+    model = self._getModel(modelId)
+    model.inputEnded = True
+    self._schedule(model)
+
+
+  def _removeModel(self, modelId, command):  # pylint: disable=W0613
+    model = self._models.pop(modelId, None)
+    if model is None:
+      # The model may have failed after the command was sent
+      g_log.info("Ignoring removal of model=%s, which is not defined",
+                 modelId)
+      return
+
+    self._unschedule(model)
+    g_log.info("Removed model=%s with %d unprocessed rows; %d models",
+               modelId, len(model.pendingRows), len(self._models))
+
+
+  def _schedule(self, model):
+    if not model.scheduled:
+      model.scheduled = True
+      self._readyModels.append(model)
+
+
+  def _unschedule(self, model):
+    if model.scheduled:
+      model.scheduled = False
+      self._readyModels.remove(model)
+
+
+  def _runRound(self):
+    """ Serve each of the models that were ready at the start of the round """
+    for _ in xrange(len(self._readyModels)):
+      model = self._readyModels.popleft()
+      model.scheduled = False
+
+      try:
+        self._serve(model)
+      except Exception:  # pylint: disable=W0703
+        self._failModel(model.modelId)
+
+
+  def _serve(self, model):
+    """ Process up to a quantum of the pending input rows of a model, and finish
+    the model if its input ended and all of its rows were processed
+    """
+    rows = model.pendingRows
+    for _ in xrange(min(self._quantum, len(rows))):
+      model.runner.processInputRow(rows.popleft())
+
+    if rows:
+      self._schedule(model)
+    elif model.inputEnded:
+      model.runner.finish()
+      del self._models[model.modelId]
+      self._writeMessage({"modelId": model.modelId, "end": True})
+      g_log.info("Finished model=%s; %d models", model.modelId,
+                 len(self._models))
+
+
+  def _failModel(self, modelId):
+    """ Remove a model after a failure and emit an error frame for it; must be
+    called from the exception handler of the failure
+    """
+    g_log.exception("Model=%s failed", modelId)
+
+    model = self._models.pop(modelId, None)
+    if model is not None:
+      self._unschedule(model)
+
+      # Emit the results that were computed before the failure
+      model.resultWriter.flush()
+
+    excValue = sys.exc_info()[1]
+    self._writeMessage({
+      "modelId": modelId,
+      "error": {
+        "errorText": str(excValue) or repr(excValue),
+        "diagnosticInfo": traceback.format_exc()
+      }
+    })
+
+
+  def _writeMessage(self, message):
+    # pylint: disable=W0212
+    model_runner_2._writeFrame(self._outputFileObj, json.dumps(message))
+
+
+
+def main():
+  # See model_runner_2.main regarding NullHandler
+  g_log.root.addHandler(logging.NullHandler())
+  inputFileObj = None
+  outputFileObj = None
+  host = None
+  try:
+    options = _parseArgs()
+
+    inputFileObj = os.fdopen(os.dup(sys.stdin.fileno()), "rb")
+    outputFileObj = model_runner_2._openBinaryStdout()  # pylint: disable=W0212
+
+    host = _ModelHost(inputFileObj=inputFileObj,
+                      outputFileObj=outputFileObj,
+                      flushRows=options.flushRows,
+                      flushLatencyMs=options.flushLatencyMs,
+                      quantum=options.quantum)
+    host.run()
+  except Exception as ex:  # pylint: disable=W0703
+    g_log.exception("ModelRunner host failed")
+
+    if host is not None:
+      # Emit the results that were computed before the failure
+      try:
+        host.flushResults()
+      except Exception:  # pylint: disable=W0703
+        g_log.exception("Failed to emit buffered results")
+
+    errorMessage = json.dumps({
+      "errorText": str(ex) or repr(ex),
+      "diagnosticInfo": traceback.format_exc()
+    })
+
+    errorMessage = "{}\n".format(errorMessage)
+
+    try:
+      sys.stderr.write(errorMessage)
+      sys.stderr.flush()
+    except Exception:  # pylint: disable=W0703
+      g_log.exception("Failed to emit error message to stderr; msg=%s",
+                      errorMessage)
+
+    # See model_runner_2.main regarding os._exit
+    os._exit(1)  # pylint: disable=W0212
+  finally:
+    if inputFileObj is not None:
+      inputFileObj.close()
+
+    if outputFileObj is not None:
+      outputFileObj.close()
+
+
+
+if __name__ == "__main__":
+  main()
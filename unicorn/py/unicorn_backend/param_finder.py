@@ -66,6 +66,17 @@ MIN_ROW_AFTER_AGGREGATION = 1000
 # encoder
 DISABLE_DAY_OF_WEEK_ENCODER = True
 
+# In coarse-to-fine mode, the wavelet coefficients of a width are computed on
+# the series decimated by the largest power of 2 that keeps the width at least
+# this many (decimated) samples. Tolerance: on the synthetic series of 10k to
+# 1M rows in tests/py/profiling/param_finder_benchmark.py, the normalized
+# wavelet variance of a width differs from the full-resolution one by less
+# than 15% (mostly under 3%, the largest differences being at the longest time
+# scales, where the fewest decimated samples remain after clipping), and the
+# suggested aggregation window and encoder choices are unchanged. Smaller
+# values are faster but less accurate.
+COARSE_TO_FINE_MIN_WIDTH = 64
+
 def _convolve(vector1, vector2, mode):
   """
   Returns the discrete, linear convolution of two one-dimensional sequences.
@@ -149,7 +160,81 @@ def _rickerWavelet(numPoints, waveletWidth):
 
 
 
-def _cwt(data, wavelet, widths):
+def _nextFastFFTLength(size):
+  """
+  Return the smallest 5-smooth number (of the form 2^a * 3^b * 5^c) that is
+  not less than `size`; FFTs of such lengths are fast.
+
+  @param size (int) minimum length
+
+  @return (int) FFT length
+  """
+  fastLength = 1
+  while fastLength < size:
+    fastLength *= 2
+
+  power5 = 1
+  while power5 < fastLength:
+    power35 = power5
+    while power35 < fastLength:
+      # Smallest power of 2 that brings power35 up to size
+      length = power35
+      while length < size:
+        length *= 2
+      fastLength = min(fastLength, length)
+      power35 *= 3
+    power5 *= 5
+
+  return fastLength
+
+
+
+def _iterCwtRows(data, wavelet, widths, useFFT=True):
+  """
+  Generate the rows of the continuous wavelet transform matrix of `data` one
+  width at a time; see `_cwt()`.
+
+  With `useFFT`, the data is transformed once and each wavelet is convolved
+  with it by multiplication in the frequency domain, which costs
+  O(N log N) per width instead of the O(N * M) of direct convolution with a
+  wavelet of M points. The results are the same up to floating point rounding.
+
+  @param data (ndarray) data on which to perform the transform
+
+  @param wavelet Wavelet function; see `_cwt()`
+
+  @param widths (sequence) Widths to use for transform
+
+  @param useFFT (bool) True to convolve via FFT; False to convolve directly
+
+  @return generator of ndarray of len(data) wavelet coefficients per width
+  """
+  data = numpy.asarray(data, dtype="float64")
+  numData = len(data)
+
+  if not useFFT:
+    for width in widths:
+      waveletData = wavelet(min(10 * width, numData), width)
+      yield _convolve(data, waveletData, mode=_CORRELATION_MODE_SAME)
+    return
+
+  # Longest wavelet; `_rickerWavelet()` returns ceil(numPoints) points
+  maxWaveletLen = int(numpy.ceil(min(10 * max(widths), numData)))
+  fftSize = _nextFastFFTLength(numData + maxWaveletLen - 1)
+  dataFFT = numpy.fft.rfft(data, fftSize)
+
+  for width in widths:
+    waveletData = wavelet(min(10 * width, numData), width)
+    fullConvolution = numpy.fft.irfft(
+      dataFFT * numpy.fft.rfft(waveletData, fftSize), fftSize)
+
+    # Same-mode output: len(data) points centered on the full convolution
+    start = (len(waveletData) - 1) // 2
+    yield fullConvolution[start:start + numData]
+
+
+
+def _cwt(data, wavelet, widths, useFFT=True):
   """
   Continuous wavelet transform.
 
@@ -169,24 +254,45 @@ def _cwt(data, wavelet, widths):
 
   @param widths (sequence) Widths to use for transform
 
+  @param useFFT (bool) True to convolve via FFT; False to convolve directly
+
   @return (ndarray) Will have shape of (len(data), len(widths))
 
   """
   output = numpy.zeros([len(widths), len(data)])
-  for ind, width in enumerate(widths):
-    waveletData = wavelet(min(10 * width, len(data)), width)
-    output[ind, :] = _convolve(data, waveletData, mode=_CORRELATION_MODE_SAME)
+  for ind, row in enumerate(_iterCwtRows(data, wavelet, widths, useFFT)):
+    output[ind, :] = row
   return output
 
 
 
-def findParameters(samples):
+def _decimate(values, factor):
+  """
+  Decimate a series by averaging consecutive blocks of `factor` samples;
+  trailing samples that don't fill a block are dropped.
+
+  @param values (ndarray) float64 values
+
+  @param factor (int) decimation factor
+
+  @return (ndarray) len(values) // factor block means
+  """
+  numBlocks = len(values) // factor
+  return values[:numBlocks * factor].reshape(numBlocks, factor).mean(axis=1)
+
+
+
+def findParameters(samples, coarseToFine=False):
   """
   Find parameters for a given time series dataset with heuristics.
 
   @param samples Sequence of two tuples (timestamp, value), where
     timestamp of type datetime.datetime and value is a number (int of float)
 
+  @param coarseToFine (bool) True to analyze long time scales on a decimated
+    series; faster on long series, and matches the full-resolution analysis
+    within the tolerance documented at COARSE_TO_FINE_MIN_WIDTH
+
   @return: JSON object with the following properties:
 
     "aggInfo" aggregation information, JSON null if no aggregation is needed
@@ -212,27 +318,55 @@ def findParameters(samples):
       corresponding to the metric value (string)
   """
   (timestamps, values) = zip(*samples)
-  numRecords = len(timestamps)
 
   if not isinstance(timestamps[0], datetime.datetime):
     raise TypeError("timestamps must be datetime type")
 
-  if numRecords > MAX_NUM_ROWS:
-    timestamps = timestamps[:MAX_NUM_ROWS]
-    values = values[:MAX_NUM_ROWS]
+  timestamps = timestamps[:MAX_NUM_ROWS]
+  values = values[:MAX_NUM_ROWS]
+
+  # make sure that timestamps are parsed in ms
+  return findParametersFromArrays(
+    timestampsInMs=numpy.array(timestamps, dtype="datetime64[ms]"),
+    values=numpy.array(values).astype("float64"),
+    coarseToFine=coarseToFine)
+
+
+
+def findParametersFromArrays(timestampsInMs, values, coarseToFine=False):
+  """
+  Find parameters for a time series dataset that is already in numpy arrays;
+  e.g., from param_finder_runner's columnar CSV reader. See `findParameters`.
+
+  @param timestampsInMs (numpy array) non-empty array of UTC timestamps of
+    type datetime64[ms]
+
+  @param values (numpy array) float64 values of the same length
+
+  @param coarseToFine (bool) see `findParameters`
+
+  @return: JSON object; see `findParameters`
+  """
+  if timestampsInMs.dtype != numpy.dtype("datetime64[ms]"):
+    raise TypeError("timestamps must be datetime64[ms] type")
+
+  if len(timestampsInMs) != len(values):
+    raise ValueError("Expected as many timestamps as values, but got {} and {}"
+                     .format(len(timestampsInMs), len(values)))
+
+  if len(values) == 0:
+    raise ValueError("No samples")
 
-  if numRecords < MIN_NUM_ROWS:
+  timestampsInMs = timestampsInMs[:MAX_NUM_ROWS]
+  values = values[:MAX_NUM_ROWS]
+
+  if len(values) < MIN_NUM_ROWS:
     outputInfo = {
       "aggInfo": None,
       "modelInfo": _getModelParams(True, False, values),
     }
     return outputInfo
 
-  # make sure that timestamps are parsed in ms
-  timestampsInMs = numpy.array(timestamps, dtype="datetime64[ms]")
-  values = numpy.array(values).astype("float64")
-
-  assert len(values) == len(timestampsInMs)
   numDataPts = len(values)
 
   medianSamplingIntervalInMs = _getMedianSamplingInterval(timestampsInMs)
@@ -243,7 +377,7 @@ def findParameters(samples):
                            medianSamplingIntervalInMs)
   
     (cwtVar, timeScaleInMs) = _calculateContinuousWaveletTransform(
-      medianSamplingIntervalInMs, values)
+      medianSamplingIntervalInMs, values, coarseToFine=coarseToFine)
       
     suggestedSamplingIntervalInMs = _determineAggregationWindow(
       timeScale=timeScaleInMs,
@@ -379,9 +513,8 @@ def _resampleData(timestamps, values, newSamplingInterval):
   
     nSampleNew = numpy.floor(totalDuration / newSamplingInterval) + 1
     nSampleNew = nSampleNew.astype("int")
-    newTimeStamps = numpy.empty(nSampleNew, dtype="datetime64[ms]")
-    for sampleI in xrange(nSampleNew):
-      newTimeStamps[sampleI] = timestamps[0] + sampleI * newSamplingInterval
+    newTimeStamps = (timestamps[0] +
+                     numpy.arange(nSampleNew) * newSamplingInterval)
   
     newValues = numpy.interp((newTimeStamps - timestamps[0]).astype("float32"),
                              (timestamps - timestamps[0]).astype("float32"),
@@ -392,7 +525,8 @@ def _resampleData(timestamps, values, newSamplingInterval):
 
 
 
-def _calculateContinuousWaveletTransform(samplingInterval, values):
+def _calculateContinuousWaveletTransform(samplingInterval, values,
+                                         coarseToFine=False, useFFT=True):
   """
   Calculate continuous wavelet transformation (CWT).
   Return variance of the cwt coefficients over time.
@@ -402,6 +536,11 @@ def _calculateContinuousWaveletTransform(samplingInterval, values):
 
   @param values: numpy array of float64 values
 
+  @param coarseToFine: (bool) True to compute the coefficients of wide
+    wavelets on a decimated series; see COARSE_TO_FINE_MIN_WIDTH
+
+  @param useFFT: (bool) True to convolve via FFT; False to convolve directly
+
   @return (tuple) Contains
     "cwtVar" (numpy array) Stores variance of the wavelet coefficents 
     "timeScale" (numpy array) Stores the corresponding time scales in ms
@@ -417,14 +556,37 @@ def _calculateContinuousWaveletTransform(samplingInterval, values):
   timeScale = widths * samplingInterval * 4
   assert timeScale.dtype == numpy.dtype('timedelta64[ms]')
 
-  # continuous wavelet transformation with ricker wavelet
-  cwtMatrix = _cwt(values, _rickerWavelet, widths)
-  # clip wavelet coefficients to minimize boundary effect
+  # Group the widths by decimation factor
+  if coarseToFine:
+    factors = numpy.maximum(
+      2 ** numpy.floor(numpy.log2(widths / COARSE_TO_FINE_MIN_WIDTH)),
+      1).astype("int")
+  else:
+    factors = numpy.ones(len(widths), dtype="int")
+
+  # number of coefficients clipped at both ends to minimize boundary effect
   maxTimeScale = int(widths[-1])
-  cwtMatrix = cwtMatrix[:, 4 * maxTimeScale:-4 * maxTimeScale]
+  numClipped = 4 * maxTimeScale
+
+  cwtVar = numpy.empty(len(widths))
+  for factor in numpy.unique(factors):
+    indices = numpy.where(factors == factor)[0]
+    series = _decimate(values, factor) if factor > 1 else values
+
+    # continuous wavelet transformation with ricker wavelet; one row at a time
+    # to avoid the memory of the whole matrix
+    rows = _iterCwtRows(series, _rickerWavelet, widths[indices] / factor,
+                        useFFT=useFFT)
+    factorClipped = int(numpy.ceil(float(numClipped) / factor))
+    for ind, row in zip(indices, rows):
+      # Wavelet normalization makes the coefficients of a series decimated by
+      # `factor` smaller by sqrt(factor)
+      if factor > 1:
+        row *= numpy.sqrt(factor)
+
+      # variance of wavelet power
+      cwtVar[ind] = numpy.var(numpy.abs(row[factorClipped:-factorClipped]))
 
-  # variance of wavelet power
-  cwtVar = numpy.var(numpy.abs(cwtMatrix), axis=1)
   cwtVar = cwtVar / numpy.sum(cwtVar)
 
   return cwtVar, timeScale
@@ -25,17 +25,20 @@ Implements Unicorn's param_finder interface.
 """
 from argparse import ArgumentParser
 import csv
+import itertools
 import json
 import logging
 import os
 import pkg_resources
+import re
 import sys
 import traceback
 
 from dateutil import tz
+import numpy
 import validictory
 
-from unicorn_backend.param_finder import findParameters
+from unicorn_backend.param_finder import findParametersFromArrays
 from unicorn_backend.param_finder import MAX_NUM_ROWS
 
 from unicorn_backend.utils import date_time_utils
@@ -44,6 +47,28 @@ from unicorn_backend.utils import na
 g_log = logging.getLogger(__name__)
 
 
+# Number of CSV rows converted to numpy arrays at a time by _readCSVColumns
+_CSV_CHUNK_NUM_ROWS = 8192
+
+# Last second of year 9999 in unix seconds, the latest timestamp that
+# datetime.utcfromtimestamp() parses
+_MAX_UNIX_SECONDS = 253402300799.0
+
+# datetime.strptime formats that numpy parses directly into datetime64 (as ISO
+# 8601), and patterns that restrict the strings to the exact layout that
+# strptime would accept for them; numpy checks the ranges of the fields
+_ISO_DATETIME_PATTERNS = dict(
+  (dateFormat, re.compile(pattern + r"\Z"))
+  for dateFormat, pattern in (
+    ("%Y-%m-%d", r"\d{4}-\d\d-\d\d"),
+    ("%Y-%m-%d %H:%M", r"\d{4}-\d\d-\d\d \d\d:\d\d"),
+    ("%Y-%m-%dT%H:%M", r"\d{4}-\d\d-\d\dT\d\d:\d\d"),
+    ("%Y-%m-%d %H:%M:%S", r"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d"),
+    ("%Y-%m-%dT%H:%M:%S", r"\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d"),
+    ("%Y-%m-%d %H:%M:%S.%f", r"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\.\d{1,6}"),
+    ("%Y-%m-%dT%H:%M:%S.%f", r"\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{1,6}")))
+
+
 
 class _CommandLineArgError(Exception):
   """ Error parsing command-line options """
@@ -194,13 +219,132 @@ def _readCSVFile(fileName,
     return samples
 
 
+def _parseTimestampColumn(timestampStrings, datetimeFormat):
+  """
+  Parse timestamp strings into UTC datetime64[ms] values, vectorized for Unix
+  timestamps and ISO 8601 layouts, and with `date_time_utils.parseDatetime`
+  for other formats or strings that don't fit the vectorized layout
+
+  :param list timestampStrings: timestamp strings
+  :param str datetimeFormat: datetime format string for
+    `date_time_utils.parseDatetime`
+  :returns: numpy array of datetime64[ms]; timestamps without timezone are
+    taken to be UTC
+  """
+  if datetimeFormat in (date_time_utils.UNIX_TIMESTAMP_SEC,
+                        date_time_utils.UNIX_TIMESTAMP_MILLISEC):
+    seconds = numpy.array(timestampStrings, dtype="float64")
+    if datetimeFormat == date_time_utils.UNIX_TIMESTAMP_MILLISEC:
+      seconds /= 1000
+
+    if len(seconds) and (seconds.min() < 0 or
+                         seconds.max() > _MAX_UNIX_SECONDS):
+      # Let the flexible parser report the offending timestamp
+      return _parseTimestampColumnWithParser(timestampStrings, datetimeFormat)
+
+    # Like datetime.utcfromtimestamp, round to microseconds first
+    milliseconds = numpy.round(seconds * 1e6).astype("int64") // 1000
+    return milliseconds.astype("datetime64[ms]")
+
+  pattern = _ISO_DATETIME_PATTERNS.get(datetimeFormat)
+  if pattern is not None and all(pattern.match(timestampString)
+                                 for timestampString in timestampStrings):
+    try:
+      return numpy.array(timestampStrings, dtype="datetime64[ms]")
+    except ValueError:
+      # E.g., a field out of range; let the flexible parser report it
+      pass
+
+  return _parseTimestampColumnWithParser(timestampStrings, datetimeFormat)
+
+
+
+def _parseTimestampColumnWithParser(timestampStrings, datetimeFormat):
+  """ Parse timestamp strings with `date_time_utils.parseDatetime`; see
+  `_parseTimestampColumn`
+  """
+  utc = tz.tzutc()
+  timestamps = []
+  for timestampString in timestampStrings:
+    timestamp = date_time_utils.parseDatetime(timestampString, datetimeFormat)
+    if timestamp.tzinfo is not None:
+      timestamp = timestamp.astimezone(utc).replace(tzinfo=None)
+    timestamps.append(timestamp)
+
+  return numpy.array(timestamps, dtype="datetime64[ms]")
+
+
+
+def _readCSVColumns(fileName,
+                    rowOffset,
+                    timestampIndex,
+                    valueIndex,
+                    datetimeFormat,
+                    maxNumRows=MAX_NUM_ROWS):
+  """
+  Columnar counterpart of `_readCSVFile`: read the timestamp and value columns
+  of a csv data file into numpy arrays, converting _CSV_CHUNK_NUM_ROWS rows at
+  a time instead of building a datetime and float object per row
+
+  :param str fileName: path to input csv file
+  :param int rowOffset: index of first data row in csv
+  :param int timestampIndex: column index of the timestamp
+  :param int valueIndex: column index of the value
+  :param str datetimeFormat: datetime format string for python's
+    datetime.strptime
+  :param int maxNumRows: maximum number of samples to read
+  :returns: two-tuple (timestamps, values) of numpy arrays of UTC
+    datetime64[ms] and float64, respectively, of the rows that have both
+    columns
+  """
+  timestampChunks = []
+  valueChunks = []
+  numRows = 0
+
+  with open(fileName, "rU") as csvFile:
+    fileReader = _createCsvReader(csvFile)
+    for _ in xrange(rowOffset):
+      fileReader.next()  # skip header line
+
+    while numRows < maxNumRows:
+      rows = list(itertools.islice(fileReader, _CSV_CHUNK_NUM_ROWS))
+      if not rows:
+        break
+
+      timestampStrings = []
+      valueStrings = []
+      for row in rows:
+        if len(row) > valueIndex:
+          timestampString = row[timestampIndex]
+          valueString = row[valueIndex]
+          if not (na.isNA(valueString) or na.isNA(timestampString)):
+            timestampStrings.append(timestampString)
+            valueStrings.append(valueString)
+
+      del timestampStrings[maxNumRows - numRows:]
+      del valueStrings[maxNumRows - numRows:]
+      numRows += len(valueStrings)
+
+      timestampChunks.append(_parseTimestampColumn(timestampStrings,
+                                                   datetimeFormat))
+      valueChunks.append(numpy.array(valueStrings, dtype="float64"))
+
+  if not valueChunks:
+    return (numpy.array([], dtype="datetime64[ms]"),
+            numpy.array([], dtype="float64"))
+
+  return numpy.concatenate(timestampChunks), numpy.concatenate(valueChunks)
+
+
+
 def main():
   # Use NullHandler for now to avoid getting the unwanted unformatted warning
   # message from logger on stderr "No handlers could be found for logger".
   g_log.addHandler(logging.NullHandler())
   try:
 
-    outputInfo = findParameters(_readCSVFile(**vars( _parseArgs())))
+    (timestamps, values) = _readCSVColumns(**vars(_parseArgs()))
+    outputInfo = findParametersFromArrays(timestamps, values)
 
     sys.stdout.write(json.dumps(outputInfo))
     sys.stdout.flush()
@@ -56,6 +56,26 @@ _MAX_UTC_OFFSET_IN_SECONDS = ((_MAX_UTC_OFFSET_PARTS[0] * 60 +
 # datetime.utcfromtimestamp() parses UNIX seconds
 _MAX_UNIX_SECONDS = 253402300799.0
 
+# Naive ISO 8601 formats that createDatetimeParser() parses with a regular
+# expression instead of datetime.strptime, and the patterns of their
+# zero-padded layouts; groups are the datetime fields in order, with the
+# fraction of the second, if any, last
+_FIXED_LAYOUT_PATTERNS = dict(
+  (dateFormat, re.compile(pattern + r"\Z"))
+  for dateFormat, pattern in (
+    ("%Y-%m-%d", r"(\d{4})-(\d\d)-(\d\d)"),
+    ("%Y-%m-%d %H:%M", r"(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d)"),
+    ("%Y-%m-%dT%H:%M", r"(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d)"),
+    ("%Y-%m-%d %H:%M:%S",
+     r"(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d)"),
+    ("%Y-%m-%dT%H:%M:%S",
+     r"(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)"),
+    ("%Y-%m-%d %H:%M:%S.%f",
+     r"(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d)\.(\d{1,6})"),
+    ("%Y-%m-%dT%H:%M:%S.%f",
+     r"(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)\.(\d{1,6})"),
+  ))
+
 def parseDatetime(dateString, dateFormat):
   """ Utility for parsing timestamps. Supports `datetime.strptime` formats
   with extensions as well as custom formats described below.
@@ -180,3 +200,43 @@ def parseDatetime(dateString, dateFormat):
     result = result.replace(tzinfo=tzinfo)
 
   return result
+
+
+
+def createDatetimeParser(dateFormat):
+  """ Create a function that parses date strings of the given format exactly
+  like `parseDatetime`, but faster when called for many strings: strings in one
+  of the zero-padded layouts of _FIXED_LAYOUT_PATTERNS are matched with a
+  precompiled regular expression instead of `datetime.strptime`. Other strings
+  and formats, as well as out-of-range fields, are handled by `parseDatetime`,
+  so the results and errors are the same.
+
+  :param str dateFormat: date format; see `parseDatetime`
+
+  :returns: function that takes a date string and returns the parsed
+    `datetime.datetime`
+  """
+  pattern = _FIXED_LAYOUT_PATTERNS.get(dateFormat)
+
+  if pattern is None:
+    return lambda dateString: parseDatetime(dateString, dateFormat)
+
+  hasFraction = dateFormat.endswith("%f")
+  matchLayout = pattern.match
+
+  def parseFixedLayout(dateString):
+    match = matchLayout(dateString)
+    if match is not None:
+      fields = [int(field) for field in match.groups()]
+      if hasFraction:
+        fields[-1] = int(match.group(match.lastindex).ljust(6, "0"))
+
+      try:
+        return datetime(*fields)
+      except ValueError:
+        # Out-of-range field; let parseDatetime report it
+        pass
+
+    return parseDatetime(dateString, dateFormat)
+
+  return parseFixedLayout
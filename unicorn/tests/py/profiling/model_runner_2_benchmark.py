@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Benchmark the replay of an input file through model_runner_2 with a stub model
+and anomaly likelihood, so that input parsing and result output dominate:
+
+  unbuffered: line per read() via _UnbufferedLineIterInputFile, a JSON line
+    and flush per result
+  lines: the default mode; buffered file iteration, a JSON line and flush per
+    result
+  throughput: the --throughput mode; chunked reads via
+    _ChunkedLineIterInputFile, length-prefixed frames of results via
+    _FramedResultWriter
+
+Results are written to a pipe that is drained by a child process, like the
+Unicorn front end reads the results from the stdout of the model runner. Also
+compares the timestamp parsing of date_time_utils.parseDatetime and
+date_time_utils.createDatetimeParser.
+"""
+
+from datetime import datetime, timedelta
+from optparse import OptionParser
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from mock import patch
+
+from unicorn_backend import model_runner_2
+from unicorn_backend.utils import date_time_utils
+
+
+
+_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Child process that drains the results and prints the number of bytes read
+_DRAIN_SCRIPT = """
+import os, sys
+numBytes = 0
+while True:
+  data = os.read(sys.stdin.fileno(), 65536)
+  if not data:
+    break
+  numBytes += len(data)
+print numBytes
+"""
+
+
+
+class _StubInferenceResult(object):
+  inferences = {"anomalyScore": 0.5}
+
+
+
+class _StubModel(object):
+
+  def run(self, inputRecord):  # pylint: disable=W0613,R0201
+    return _StubInferenceResult
+
+
+
+class _StubAnomalyLikelihood(object):
+
+  def anomalyProbability(self, value, anomalyScore, timestamp):
+    # pylint: disable=W0613,R0201
+    return 0.5
+
+
+  def computeLogLikelihood(self, probability):  # pylint: disable=R0201
+    return probability / 2
+
+
+
+def _parseArgs():
+  parser = OptionParser(usage="%prog [options]\n\n" + __doc__.strip())
+
+  parser.add_option("--rows", type="int", default=100000, dest="numRows",
+                    help="Number of input rows [default: %default]")
+  parser.add_option("--agg-window", type="int", default=0, dest="aggWindow",
+                    help=("Aggregation window in seconds; 0 for no aggregation "
+                          "[default: %default]"))
+  parser.add_option("--flush-rows", type="int",
+                    default=model_runner_2._DEFAULT_FLUSH_ROWS,
+                    dest="flushRows",
+                    help="Throughput mode batch bound [default: %default]")
+
+  options, remainingArgs = parser.parse_args()
+  if remainingArgs:
+    parser.error("Unexpected remaining args: %r" % (remainingArgs,))
+
+  return options.__dict__
+
+
+
+def _writeInputFile(path, numRows):
+  timestamp = datetime(2015, 1, 1)
+  step = timedelta(seconds=60)
+  with open(path, "wb") as fileObj:
+    fileObj.write("timestamp,value\r\n")
+    for i in xrange(numRows):
+      fileObj.write("%s,%d\r\n" % (timestamp.strftime(_DATETIME_FORMAT),
+                                   i % 100))
+      timestamp += step
+
+
+
+def _replay(mode, inputPath, aggSpec, flushRows):
+  """
+  :returns: (durationSec, outputBytes)
+  """
+  inputSpec = dict(rowOffset=1,
+                   timestampIndex=0,
+                   valueIndex=1,
+                   datetimeFormat=_DATETIME_FORMAT)
+  modelSpec = dict(modelId="benchmark",
+                   modelConfig={},
+                   inferenceArgs={},
+                   timestampFieldName="c0",
+                   valueFieldName="c1")
+
+  drainProcess = subprocess.Popen([sys.executable, "-c", _DRAIN_SCRIPT],
+                                  stdin=subprocess.PIPE,
+                                  stdout=subprocess.PIPE)
+  outputFileObj = drainProcess.stdin
+
+  start = time.time()
+
+  with open(inputPath, "rb" if mode == "throughput" else "rU") as inputFileObj:
+    if mode == "throughput":
+      resultWriter = model_runner_2._FramedResultWriter(
+        outputFileObj,
+        maxRows=flushRows,
+        maxLatency=model_runner_2._DEFAULT_FLUSH_LATENCY_MS / 1000.0)
+      modelInputFileObj = model_runner_2._ChunkedLineIterInputFile(
+        inputFileObj, beforeRead=resultWriter.flush)
+    else:
+      resultWriter = model_runner_2._LineResultWriter(outputFileObj)
+      if mode == "unbuffered":
+        modelInputFileObj = model_runner_2._UnbufferedLineIterInputFile(
+          inputFileObj)
+      else:
+        modelInputFileObj = inputFileObj
+
+    model_runner_2._ModelRunner(
+      inputFileObj=modelInputFileObj,
+      inputSpec=inputSpec,
+      aggSpec=aggSpec,
+      modelSpec=modelSpec,
+      resultWriter=resultWriter).run()
+
+  duration = time.time() - start
+
+  outputFileObj.close()
+  outputBytes = int(drainProcess.stdout.read())
+  drainProcess.wait()
+
+  return duration, outputBytes
+
+
+
+def _benchmarkTimestampParsing(numRows):
+  timestamp = datetime(2015, 1, 1)
+  dateStrings = [(timestamp + timedelta(seconds=60 * i))
+                 .strftime(_DATETIME_FORMAT)
+                 for i in xrange(numRows)]
+
+  start = time.time()
+  for dateString in dateStrings:
+    date_time_utils.parseDatetime(dateString, _DATETIME_FORMAT)
+  parseDatetimeDuration = time.time() - start
+
+  parse = date_time_utils.createDatetimeParser(_DATETIME_FORMAT)
+  start = time.time()
+  for dateString in dateStrings:
+    parse(dateString)
+  createDatetimeParserDuration = time.time() - start
+
+  print ("Parsing %d timestamps: parseDatetime %.2fs, createDatetimeParser "
+         "%.2fs" % (numRows, parseDatetimeDuration,
+                    createDatetimeParserDuration))
+
+
+
+def main(numRows, aggWindow, flushRows):
+  aggSpec = dict(windowSize=aggWindow, func="mean") if aggWindow else None
+
+  tempDir = tempfile.mkdtemp()
+  try:
+    inputPath = os.path.join(tempDir, "input.csv")
+    _writeInputFile(inputPath, numRows)
+
+    with patch.object(model_runner_2._ModelRunner, "_createModel",
+                      new=staticmethod(lambda modelSpec: _StubModel())), \
+        patch.object(model_runner_2, "AnomalyLikelihood",
+                     new=_StubAnomalyLikelihood):
+      print "%-11s %9s %10s %13s" % ("mode", "time(s)", "rows/sec",
+                                     "output bytes")
+      for mode in ("unbuffered", "lines", "throughput"):
+        duration, outputBytes = _replay(mode, inputPath, aggSpec, flushRows)
+        print "%-11s %9.2f %10d %13d" % (mode, duration, numRows / duration,
+                                         outputBytes)
+
+    _benchmarkTimestampParsing(numRows)
+  finally:
+    shutil.rmtree(tempDir)
+
+
+
+if __name__ == "__main__":
+  main(**_parseArgs())
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Benchmark running many models with a model_runner_2 process per model versus a
+single model_runner_host process.
+
+The models are stubs, so that the comparison measures the overhead of a
+process per model: the interpreter, the imported modules and the scheduling of
+the processes; the anomaly likelihood is NuPIC's. The state of real models adds
+the same amount of memory per model in both setups.
+
+Each model_runner_2 process replays its own input file in --throughput mode;
+the host reads the same rows from a file of input frames. Prints the wall time
+until all processes are done, the aggregate input rows per second, the sum of
+the peak resident set sizes of the processes and that sum per model.
+"""
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+import json
+from optparse import OptionParser
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from mock import patch
+
+from unicorn_backend import model_runner_2
+from unicorn_backend import model_runner_host
+
+
+
+_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_INPUT_SPEC = dict(rowOffset=0,
+                   timestampIndex=0,
+                   valueIndex=1,
+                   datetimeFormat=_DATETIME_FORMAT)
+
+# Number of input rows per "rows" command of the host
+_ROWS_PER_FRAME = 100
+
+
+
+_StubModelResult = namedtuple("_StubModelResult", "inferences")
+
+
+
+class _StubModel(object):
+
+  def __init__(self):
+    self.total = 0.0
+
+
+  def run(self, inputRecord):
+    self.total += inputRecord["c1"]
+    return _StubModelResult(inferences={"anomalyScore": self.total % 1.0})
+
+
+
+def _parseArgs():
+  parser = OptionParser(usage="%prog [options]\n\n" + __doc__.strip())
+
+  parser.add_option("--models", default="1,10,30", dest="models",
+                    help=("Comma-separated numbers of models "
+                          "[default: %default]"))
+  parser.add_option("--rows", type="int", default=2000, dest="numRows",
+                    help="Number of input rows per model [default: %default]")
+  # Internal: run model_runner_2 or model_runner_host in a child process
+  parser.add_option("--child", nargs=2, dest="child",
+                    help="runner|host JSON_ARGV")
+
+  options, remainingArgs = parser.parse_args()
+  if remainingArgs:
+    parser.error("Unexpected remaining args: %r" % (remainingArgs,))
+
+  return dict(models=[int(value) for value in options.models.split(",")],
+              numRows=options.numRows,
+              child=options.child)
+
+
+
+def _createModelSpec(modelId):
+  return dict(modelId=modelId,
+              modelConfig={},
+              inferenceArgs={},
+              timestampFieldName="c0",
+              valueFieldName="c1")
+
+
+
+def _createRows(numRows, seed):
+  timestamp = datetime(2015, 1, 1)
+  step = timedelta(seconds=300)
+  rows = []
+  for i in xrange(numRows):
+    rows.append([timestamp.strftime(_DATETIME_FORMAT),
+                 str((i * seed) % 100)])
+    timestamp += step
+
+  return rows
+
+
+
+def _runChild(kind, argv):
+  """ Run model_runner_2 or model_runner_host with stub models and print the
+  peak RSS in KB to stderr
+  """
+  with patch.object(model_runner_2._ModelRunner, "_createModel",
+                    new=staticmethod(lambda modelSpec: _StubModel())):
+    sys.argv = [kind] + json.loads(argv)
+    if kind == "runner":
+      model_runner_2.main()
+    else:
+      model_runner_host.main()
+
+  # ru_maxrss is in KB on Linux
+  sys.stderr.write("%d\n" % (resource.getrusage(
+    resource.RUSAGE_SELF).ru_maxrss,))
+
+
+
+def _startChild(kind, argv, inputPath, outputPath):
+  with open(inputPath, "rb") as inputFileObj, \
+      open(outputPath, "wb") as outputFileObj:
+    return subprocess.Popen(
+      [sys.executable, os.path.abspath(__file__),
+       "--child", kind, json.dumps(argv)],
+      stdin=inputFileObj,
+      stdout=outputFileObj,
+      stderr=subprocess.PIPE)
+
+
+
+def _waitForChildren(processes):
+  """
+  :returns: sum of the peak RSS of the processes in KB
+  """
+  totalPeakRSS = 0
+  for process in processes:
+    _, stderr = process.communicate()
+    if process.returncode != 0:
+      raise RuntimeError("Child failed: %s" % (stderr,))
+
+    totalPeakRSS += int(stderr.split()[-1])
+
+  return totalPeakRSS
+
+
+
+def _readFrames(path):
+  with open(path, "rb") as fileObj:
+    while True:
+      payload = model_runner_host._readFrame(fileObj)
+      if payload is None:
+        return
+
+      yield json.loads(payload)
+
+
+
+def _runProcessPerModel(tempDir, modelRows):
+  """
+  :returns: (durationSec, totalPeakRSSInKB, numResults)
+  """
+  processes = []
+  outputPaths = []
+  start = time.time()
+  for i, rows in enumerate(modelRows):
+    inputPath = os.path.join(tempDir, "input_%d.csv" % (i,))
+    with open(inputPath, "wb") as fileObj:
+      fileObj.writelines("%s\n" % (",".join(row),) for row in rows)
+
+    outputPath = os.path.join(tempDir, "output_%d" % (i,))
+    outputPaths.append(outputPath)
+    processes.append(_startChild(
+      "runner",
+      ["--input", json.dumps(dict(_INPUT_SPEC, csv=inputPath)),
+       "--model", json.dumps(_createModelSpec("model%d" % (i,))),
+       "--throughput"],
+      inputPath=os.devnull,
+      outputPath=outputPath))
+
+  totalPeakRSS = _waitForChildren(processes)
+  duration = time.time() - start
+
+  numResults = sum(len(frame)
+                   for outputPath in outputPaths
+                   for frame in _readFrames(outputPath))
+
+  return duration, totalPeakRSS, numResults
+
+
+
+def _runHost(tempDir, modelRows):
+  """
+  :returns: (durationSec, totalPeakRSSInKB, numResults)
+  """
+  inputPath = os.path.join(tempDir, "input_frames")
+  with open(inputPath, "wb") as fileObj:
+    def writeMessage(message):
+      model_runner_2._writeFrame(fileObj, json.dumps(message))
+
+    for i in xrange(len(modelRows)):
+      writeMessage({"command": "defineModel",
+                    "modelId": "model%d" % (i,),
+                    "input": _INPUT_SPEC,
+                    "agg": None,
+                    "model": _createModelSpec("model%d" % (i,))})
+
+    # Interleave the rows of the models like concurrent uploads
+    numRows = len(modelRows[0])
+    for offset in xrange(0, numRows, _ROWS_PER_FRAME):
+      for i, rows in enumerate(modelRows):
+        writeMessage({"command": "rows",
+                      "modelId": "model%d" % (i,),
+                      "rows": rows[offset:offset + _ROWS_PER_FRAME]})
+
+  outputPath = os.path.join(tempDir, "output_host")
+  start = time.time()
+  totalPeakRSS = _waitForChildren([
+    _startChild("host", [], inputPath=inputPath, outputPath=outputPath)])
+  duration = time.time() - start
+
+  numResults = 0
+  for frame in _readFrames(outputPath):
+    if "error" in frame:
+      raise RuntimeError("Model failed in host: %s" % (frame,))
+
+    numResults += len(frame.get("results", ()))
+
+  return duration, totalPeakRSS, numResults
+
+
+
+def main(models, numRows, child):
+  if child:
+    _runChild(*child)
+    return
+
+  print "%-7s %-17s %9s %10s %15s %16s" % ("models", "setup", "time(s)",
+                                           "rows/sec", "totalRSS(MB)",
+                                           "RSS/model(MB)")
+  for numModels in models:
+    modelRows = [_createRows(numRows, seed=i + 1) for i in xrange(numModels)]
+
+    for setup, runSetup in (("process-per-model", _runProcessPerModel),
+                            ("host", _runHost)):
+      tempDir = tempfile.mkdtemp()
+      try:
+        duration, totalPeakRSS, numResults = runSetup(tempDir, modelRows)
+      finally:
+        shutil.rmtree(tempDir)
+
+      assert numResults == numModels * numRows, (numResults, numModels,
+                                                 numRows)
+      print "%-7d %-17s %9.2f %10d %15.1f %16.1f" % (
+        numModels, setup, duration, numModels * numRows / duration,
+        totalPeakRSS / 1024.0, totalPeakRSS / 1024.0 / numModels)
+
+
+
+if __name__ == "__main__":
+  main(**_parseArgs())
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Benchmark the wavelet analysis of param_finder, which dominates the run time of
+findParameters() on long series, with direct convolution, FFT convolution and
+FFT convolution in coarse-to-fine mode.
+
+For each number of rows and synthetic series, prints the run time of each
+method, the largest relative difference of the normalized wavelet variance
+from the full-resolution FFT result, and whether the suggested aggregation
+window and encoder choices match.
+"""
+
+from optparse import OptionParser
+import time
+
+import numpy
+
+from unicorn_backend import param_finder
+
+
+
+_SAMPLING_INTERVAL_SEC = 60
+
+
+
+def _parseArgs():
+  parser = OptionParser(usage="%prog [options]\n\n" + __doc__.strip())
+
+  parser.add_option("--rows", default="10000,100000,1000000", dest="rows",
+                    help=("Comma-separated numbers of rows "
+                          "[default: %default]"))
+  parser.add_option("--max-direct-rows", type="int", default=100000,
+                    dest="maxDirectRows",
+                    help=("Skip direct convolution, whose cost is quadratic, "
+                          "above this many rows [default: %default]"))
+
+  options, remainingArgs = parser.parse_args()
+  if remainingArgs:
+    parser.error("Unexpected remaining args: %r" % (remainingArgs,))
+
+  return dict(rows=[int(value) for value in options.rows.split(",")],
+              maxDirectRows=options.maxDirectRows)
+
+
+
+def _generateSeries(numRows):
+  """ Yield (name, values) of the synthetic series """
+  rnd = numpy.random.RandomState(42)
+  timeInSec = numpy.arange(numRows) * float(_SAMPLING_INTERVAL_SEC)
+
+  yield "daily", (numpy.sin(2 * numpy.pi * timeInSec / 86400.0) +
+                  0.3 * rnd.randn(numRows))
+  yield "weekly", (numpy.sin(2 * numpy.pi * timeInSec / 604800.0) +
+                   0.2 * rnd.randn(numRows))
+  yield "randomWalk", numpy.cumsum(rnd.randn(numRows))
+  yield "binary", (rnd.rand(numRows) < 0.1).astype("float64")
+
+
+
+def _analyze(values, samplingInterval, method):
+  """
+  :returns: (durationSec, cwtVar, aggregationWindowInMs, encoderTypes)
+  """
+  start = time.time()
+  cwtVar, timeScale = param_finder._calculateContinuousWaveletTransform(
+    samplingInterval, values,
+    coarseToFine=(method == "coarseToFine"),
+    useFFT=(method != "direct"))
+  duration = time.time() - start
+
+  aggregationWindow = param_finder._determineAggregationWindow(
+    timeScale=timeScale,
+    cwtVar=cwtVar,
+    thresh=param_finder._AGGREGATION_WINDOW_THRESH,
+    samplingInterval=samplingInterval,
+    numDataPts=len(values))
+
+  encoderTypes = param_finder._determineEncoderTypes(
+    cwtVar, timeScale.astype("timedelta64[s]"))
+
+  return duration, cwtVar, aggregationWindow.astype("int"), encoderTypes
+
+
+
+def main(rows, maxDirectRows):
+  samplingInterval = numpy.timedelta64(_SAMPLING_INTERVAL_SEC * 1000, "ms")
+
+  print "%-8s %-10s %-13s %9s %9s %s" % ("rows", "series", "method",
+                                         "time(s)", "maxRelErr",
+                                         "window(ms) encoders match")
+
+  for numRows in rows:
+    for name, values in _generateSeries(numRows):
+      methods = ["fft", "coarseToFine"]
+      if numRows <= maxDirectRows:
+        methods.insert(0, "direct")
+
+      results = dict((method, _analyze(values, samplingInterval, method))
+                     for method in methods)
+      _, referenceVar, referenceWindow, referenceEncoders = results["fft"]
+
+      for method in methods:
+        duration, cwtVar, window, encoders = results[method]
+        print "%-8d %-10s %-13s %9.2f %9.2e %s %s %s" % (
+          numRows, name, method, duration,
+          numpy.max(numpy.abs(cwtVar - referenceVar) / referenceVar),
+          window, encoders,
+          window == referenceWindow and encoders == referenceEncoders)
+
+
+
+if __name__ == "__main__":
+  main(**_parseArgs())
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Benchmark CSV ingest of param_finder_runner: the row-wise reader, which builds
+a list of (datetime, float) tuples, versus the columnar reader, which parses
+chunks of rows into numpy arrays; and the per-sample loop that used to build
+the resampled timestamps of param_finder._resampleData versus the vectorized
+version.
+
+Each reader runs in a child process, so that its peak resident set size is
+measured in isolation. The row limit of both readers is raised to the number of
+rows of the input file.
+"""
+
+from optparse import OptionParser
+import csv
+import datetime
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy
+
+from unicorn_backend import param_finder
+from unicorn_backend import param_finder_runner
+
+
+
+_SAMPLING_INTERVAL_SEC = 60
+
+_TIMESTAMP_FORMATS = {
+  "iso": ("%Y-%m-%d %H:%M:%S",
+          lambda ts: ts.strftime("%Y-%m-%d %H:%M:%S")),
+  "unix": ("#T",
+           lambda ts: "%d" % ((ts - datetime.datetime(1970, 1, 1))
+                              .total_seconds(),)),
+  "custom": ("%m/%d/%Y %H:%M",
+             lambda ts: ts.strftime("%m/%d/%Y %H:%M")),
+}
+
+
+
+def _parseArgs():
+  parser = OptionParser(usage="%prog [options]\n\n" + __doc__.strip())
+
+  parser.add_option("--rows", default="100000,1000000", dest="rows",
+                    help=("Comma-separated numbers of rows "
+                          "[default: %default]"))
+  parser.add_option("--formats", default="iso,unix,custom", dest="formats",
+                    help=("Comma-separated timestamp formats of the input: "
+                          "%s [default: %%default]"
+                          % (", ".join(sorted(_TIMESTAMP_FORMATS)),)))
+  # Internal: run a single reader in a child process
+  parser.add_option("--child", nargs=3, dest="child",
+                    help="READER FORMAT FILE")
+
+  options, remainingArgs = parser.parse_args()
+  if remainingArgs:
+    parser.error("Unexpected remaining args: %r" % (remainingArgs,))
+
+  return dict(rows=[int(value) for value in options.rows.split(",")],
+              formats=options.formats.split(","),
+              child=options.child)
+
+
+
+def _writeCSVFile(path, numRows, formatName):
+  _, formatTimestamp = _TIMESTAMP_FORMATS[formatName]
+  rnd = numpy.random.RandomState(42)
+  values = rnd.randn(numRows)
+  timestamp = datetime.datetime(2015, 1, 1)
+  step = datetime.timedelta(seconds=_SAMPLING_INTERVAL_SEC)
+
+  with open(path, "wb") as csvFile:
+    csvWriter = csv.writer(csvFile)
+    csvWriter.writerow(["timestamp", "value"])
+    for i in xrange(numRows):
+      csvWriter.writerow([formatTimestamp(timestamp), "%.6f" % (values[i],)])
+      timestamp += step
+
+
+
+def _runChild(readerName, formatName, path):
+  """ Read the file with the given reader and print duration, number of
+  samples and peak RSS
+  """
+  datetimeFormat, _ = _TIMESTAMP_FORMATS[formatName]
+  params = dict(fileName=path,
+                rowOffset=1,
+                timestampIndex=0,
+                valueIndex=1,
+                datetimeFormat=datetimeFormat)
+
+  start = time.time()
+  if readerName == "rows":
+    param_finder_runner.MAX_NUM_ROWS = sys.maxint
+    samples = param_finder_runner._readCSVFile(**params)
+    numSamples = len(samples)
+  else:
+    timestamps, _ = param_finder_runner._readCSVColumns(maxNumRows=sys.maxint,
+                                                        **params)
+    numSamples = len(timestamps)
+  duration = time.time() - start
+
+  # ru_maxrss is in KB on Linux
+  print duration, numSamples, resource.getrusage(
+    resource.RUSAGE_SELF).ru_maxrss
+
+
+
+def _measureReader(readerName, formatName, path):
+  """
+  :returns: (durationSec, numSamples, peakRSSInKB)
+  """
+  output = subprocess.check_output(
+    [sys.executable, os.path.abspath(__file__),
+     "--child", readerName, formatName, path])
+  duration, numSamples, peakRSS = output.split()
+  return float(duration), int(numSamples), int(peakRSS)
+
+
+
+def _resampleTimestampsLoop(timestamps, nSampleNew, newSamplingInterval):
+  """ Resampled timestamps as built before vectorization """
+  newTimeStamps = numpy.empty(nSampleNew, dtype="datetime64[ms]")
+  for sampleI in xrange(nSampleNew):
+    newTimeStamps[sampleI] = timestamps[0] + sampleI * newSamplingInterval
+  return newTimeStamps
+
+
+
+def _benchmarkResampling(numRows):
+  samplingInterval = numpy.timedelta64(_SAMPLING_INTERVAL_SEC * 1000, "ms")
+  timestamps = (numpy.datetime64("2015-01-01T00:00:00", "ms") +
+                numpy.arange(numRows) * samplingInterval)
+  values = numpy.random.RandomState(42).randn(numRows)
+
+  start = time.time()
+  loopTimestamps = _resampleTimestampsLoop(timestamps, numRows,
+                                           samplingInterval)
+  loopDuration = time.time() - start
+
+  start = time.time()
+  param_finder._resampleData(timestamps, values, samplingInterval)
+  vectorizedDuration = time.time() - start
+
+  assert numpy.array_equal(
+    loopTimestamps,
+    timestamps[0] + numpy.arange(numRows) * samplingInterval)
+
+  print ("%-8d resampled timestamps: loop %.2fs, vectorized _resampleData "
+         "%.2fs" % (numRows, loopDuration, vectorizedDuration))
+
+
+
+def main(rows, formats, child):
+  if child:
+    _runChild(*child)
+    return
+
+  tempDir = tempfile.mkdtemp()
+  try:
+    print "%-8s %-7s %-8s %9s %12s %9s" % ("rows", "format", "reader",
+                                           "time(s)", "peakRSS(MB)",
+                                           "rows/sec")
+    for numRows in rows:
+      for formatName in formats:
+        path = os.path.join(tempDir, "%s_%d.csv" % (formatName, numRows))
+        _writeCSVFile(path, numRows, formatName)
+
+        for readerName in ("rows", "columns"):
+          duration, numSamples, peakRSS = _measureReader(readerName,
+                                                         formatName, path)
+          assert numSamples == numRows, (numSamples, numRows)
+          print "%-8d %-7s %-8s %9.2f %12.1f %9d" % (
+            numRows, formatName, readerName, duration, peakRSS / 1024.0,
+            numRows / duration)
+
+        os.unlink(path)
+
+      _benchmarkResampling(numRows)
+  finally:
+    shutil.rmtree(tempDir)
+
+
+
+if __name__ == "__main__":
+  main(**_parseArgs())
@@ -1298,3 +1298,45 @@ class ExtendedStrptimeTestCase(unittest.TestCase):
       excCtx.exception.args[0],
       "time data '2016-01-29T23:00:00.123+' does not match format "
       "'%Y-%m-%dT%H:%M:%S.%f%z'")
+
+
+
+class CreateDatetimeParserTestCase(unittest.TestCase):
+
+  def testResultsAndErrorsMatchParseDatetime(self):
+    samples = (
+      ("%Y-%m-%d", "2016-01-29"),
+      ("%Y-%m-%d", "2016-1-29"),
+      ("%Y-%m-%d", "2016-02-30"),
+      ("%Y-%m-%d %H:%M", "2016-01-29 23:59"),
+      ("%Y-%m-%dT%H:%M", "2016-01-29T23:59"),
+      ("%Y-%m-%d %H:%M:%S", "2016-01-29 23:00:01"),
+      ("%Y-%m-%d %H:%M:%S", "2016-01-29 23:00:61"),
+      ("%Y-%m-%d %H:%M:%S", "2016-01-29 24:00:00"),
+      ("%Y-%m-%d %H:%M:%S", "2016-01-29 23:00:01 "),
+      ("%Y-%m-%d %H:%M:%S", "2016-01-29T23:00:01"),
+      ("%Y-%m-%dT%H:%M:%S", "2016-01-29T23:00:01"),
+      ("%Y-%m-%d %H:%M:%S.%f", "2016-01-29 23:00:01.1"),
+      ("%Y-%m-%dT%H:%M:%S.%f", "2016-01-29T23:00:01.000123"),
+      ("%Y-%m-%dT%H:%M:%S.%f", "2016-01-29T23:00:01.1234567"),
+      ("%Y-%m-%dT%H:%M:%S.%f%z", "2016-01-29T23:00:01.123+0130"),
+      ("%m/%d/%y %H:%M", "01/29/16 23:00"),
+      ("#T", "1465257536.142103"),
+      ("#t", "1465257536142.103"),
+    )
+
+    for dateFormat, dateString in samples:
+      parse = date_time_utils.createDatetimeParser(dateFormat)
+
+      try:
+        expected = date_time_utils.parseDatetime(dateString, dateFormat)
+      except ValueError as exc:
+        with self.assertRaises(ValueError) as excCtx:
+          parse(dateString)
+
+        self.assertEqual(excCtx.exception.args, exc.args)
+      else:
+        result = parse(dateString)
+        self.assertEqual(result, expected)
+        self.assertEqual(result.isoformat(), expected.isoformat())
+
@@ -21,9 +21,18 @@
 
 """Unit test of the unicorn_backend.model_runner_2 module"""
 
+from collections import namedtuple
+import csv
+from datetime import datetime, timedelta
+import json
 import logging
-from mock import patch
+from mock import Mock, patch
+import os
+import shutil
+import pickle
+from StringIO import StringIO
 import sys
+import tempfile
 import unittest
 
 from unicorn_backend import model_runner_2
@@ -34,6 +43,83 @@ _LOGGER = logging.getLogger("unicorn_model_runner_2_test")
 
 
 
+_StubModelResult = namedtuple("_StubModelResult", "inferences")
+
+
+
+class _StubModel(object):
+  """ Deterministic stand-in for an OPF model whose anomaly scores depend on
+  all the records it has seen
+  """
+
+  def __init__(self):
+    self.total = 0.0
+
+
+  def run(self, inputRecord):
+    self.total += inputRecord["c1"]
+    return _StubModelResult(inferences={"anomalyScore": self.total % 1.0})
+
+
+  def save(self, saveModelDir):
+    os.mkdir(saveModelDir)
+    with open(os.path.join(saveModelDir, "model.pkl"), "wb") as fileObj:
+      pickle.dump(self, fileObj)
+
+
+  @staticmethod
+  def loadFromCheckpoint(savedModelDir):
+    with open(os.path.join(savedModelDir, "model.pkl"), "rb") as fileObj:
+      return pickle.load(fileObj)
+
+
+
+class _InterruptedError(Exception):
+  pass
+
+
+
+class _InterruptingResultWriter(object):
+  """ Line result writer that fails after a number of results, like a runner
+  that is killed
+  """
+
+  def __init__(self, outputFileObj, maxResults):
+    # pylint: disable=W0212
+    self._lineResultWriter = model_runner_2._LineResultWriter(outputFileObj)
+    self._maxResults = maxResults
+
+
+  def write(self, *args):
+    if self._maxResults == 0:
+      raise _InterruptedError()
+
+    self._maxResults -= 1
+    self._lineResultWriter.write(*args)
+
+
+  def flush(self):
+    pass
+
+
+
+def _decodeFrames(data):
+  """ Decode the output of _FramedResultWriter
+
+  :returns: list of frames, each a list of results
+  """
+  frames = []
+  offset = 0
+  while offset < len(data):
+    (payloadLength,) = model_runner_2._FRAME_HEADER.unpack_from(data, offset)
+    offset += model_runner_2._FRAME_HEADER.size
+    frames.append(json.loads(data[offset:offset + payloadLength]))
+    offset += payloadLength
+
+  return frames
+
+
+
 
 class ModelRunnerTestCase(unittest.TestCase):
 
@@ -80,3 +166,408 @@ class ModelRunnerTestCase(unittest.TestCase):
                                 "argument --input is required")
 
     _assertArgumentPatternFails(['--input="{}"', '--model="{}"'])
+
+
+  def testParseArgsRejectsInvalidFlushBounds(self):
+    inputSpec = json.dumps(dict(rowOffset=0,
+                                timestampIndex=0,
+                                valueIndex=1,
+                                datetimeFormat="%Y-%m-%d %H:%M:%S"))
+    modelSpec = json.dumps(dict(modelConfig={},
+                                inferenceArgs={},
+                                timestampFieldName="c0",
+                                valueFieldName="c1"))
+
+    for flushOption in ("--flushRows=0", "--flushLatencyMs=-1"):
+      argv = ["unicorn_backend/model_runner_2.py",
+              "--input=" + inputSpec,
+              "--model=" + modelSpec,
+              "--throughput",
+              flushOption]
+
+      with patch.object(sys, "argv", argv):
+        # pylint: disable=W0212
+        with self.assertRaises(model_runner_2._CommandLineArgError):
+          model_runner_2._parseArgs()
+
+  def testParseArgsRejectsInvalidCheckpointOptions(self):
+    inputSpec = dict(rowOffset=0,
+                     timestampIndex=0,
+                     valueIndex=1,
+                     datetimeFormat="%Y-%m-%d %H:%M:%S")
+    modelSpec = json.dumps(dict(modelConfig={},
+                                inferenceArgs={},
+                                timestampFieldName="c0",
+                                valueFieldName="c1"))
+    csvInputSpec = json.dumps(dict(inputSpec, csv="/tmp/input.csv"))
+
+    for inputArg, checkpointArgs, excSubstring in (
+        (json.dumps(inputSpec), ["--checkpointDir=/tmp/checkpoints"],
+         "--checkpointDir requires csv"),
+        (csvInputSpec, ["--resume"],
+         "--resume requires --checkpointDir"),
+        (csvInputSpec,
+         ["--checkpointDir=/tmp/checkpoints", "--checkpointInterval=0"],
+         "--checkpointInterval must be positive")):
+      argv = (["unicorn_backend/model_runner_2.py",
+               "--input=" + inputArg,
+               "--model=" + modelSpec] +
+              checkpointArgs)
+
+      with patch.object(sys, "argv", argv):
+        # pylint: disable=W0212
+        with self.assertRaises(model_runner_2._CommandLineArgError) as excCtx:
+          model_runner_2._parseArgs()
+
+      self.assertIn(excSubstring, str(excCtx.exception))
+
+    argv = ["unicorn_backend/model_runner_2.py",
+            "--input=" + csvInputSpec,
+            "--model=" + modelSpec,
+            "--checkpointDir=/tmp/checkpoints",
+            "--checkpointInterval=500",
+            "--resume"]
+    with patch.object(sys, "argv", argv):
+      options = model_runner_2._parseArgs()  # pylint: disable=W0212
+
+    self.assertEqual(options.checkpointDir, "/tmp/checkpoints")
+    self.assertEqual(options.checkpointInterval, 500)
+    self.assertTrue(options.resume)
+
+
+
+class ChunkedLineIterInputFileTestCase(unittest.TestCase):
+
+  def testLinesMatchUniversalNewlinesMode(self):
+    tempDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tempDir)
+    path = os.path.join(tempDir, "input.csv")
+
+    with open(path, "wb") as fileObj:
+      fileObj.write('a,1\r\nb,2\rc,3\n"multi\r\nline",4\n\nlast,5\r')
+
+    with open(path, "rU") as fileObj:
+      expectedLines = list(fileObj)
+      fileObj.seek(0)
+      expectedRows = list(csv.reader(fileObj))
+
+    # Chunk sizes that split lines and CRLF line endings
+    for chunkSize in (1, 2, 3, 4, 1000):
+      reads = []
+      with open(path, "rb") as fileObj:
+        # pylint: disable=W0212
+        lines = list(model_runner_2._ChunkedLineIterInputFile(
+          fileObj,
+          chunkSize=chunkSize,
+          beforeRead=lambda: reads.append(None)))
+
+        fileObj.seek(0)
+        rows = list(csv.reader(model_runner_2._ChunkedLineIterInputFile(
+          fileObj, chunkSize=chunkSize)))
+
+      self.assertEqual(lines, expectedLines, chunkSize)
+      self.assertEqual(rows, expectedRows, chunkSize)
+
+      # One read per chunk and a final one that returns EOF
+      fileSize = os.path.getsize(path)
+      self.assertEqual(len(reads), (fileSize + chunkSize - 1) // chunkSize + 1)
+
+
+
+class FramedResultWriterTestCase(unittest.TestCase):
+
+  def testFramesAreBoundedByRowCount(self):
+    outputFileObj = StringIO()
+    # pylint: disable=W0212
+    writer = model_runner_2._FramedResultWriter(outputFileObj,
+                                                maxRows=3,
+                                                maxLatency=60)
+
+    timestamp = datetime(2016, 1, 1)
+    for i in xrange(7):
+      writer.write(timestamp + timedelta(minutes=i), float(i), i / 10.0)
+
+    frames = _decodeFrames(outputFileObj.getvalue())
+    self.assertEqual([len(frame) for frame in frames], [3, 3])
+    self.assertEqual(frames[1][0], ["2016-01-01T00:03:00", 3.0, 0.3])
+
+    writer.flush()
+    writer.flush()
+
+    frames = _decodeFrames(outputFileObj.getvalue())
+    self.assertEqual([len(frame) for frame in frames], [3, 3, 1])
+    self.assertEqual(frames[2], [["2016-01-01T00:06:00", 6.0, 0.6]])
+
+
+  def testFramesAreBoundedByLatency(self):
+    outputFileObj = StringIO()
+    # pylint: disable=W0212
+    writer = model_runner_2._FramedResultWriter(outputFileObj,
+                                                maxRows=100,
+                                                maxLatency=0.5)
+
+    timestamp = datetime(2016, 1, 1)
+    with patch.object(model_runner_2.time, "time", autospec=True,
+                      side_effect=[10.0, 10.2, 10.5, 11.0, 11.1]):
+      for i in xrange(5):
+        writer.write(timestamp, float(i), 0.0)
+
+        if i == 1:
+          self.assertEqual(outputFileObj.getvalue(), "")
+
+    # The third result was written 0.5 seconds after the first one
+    frames = _decodeFrames(outputFileObj.getvalue())
+    self.assertEqual([len(frame) for frame in frames], [3])
+
+    writer.flush()
+    frames = _decodeFrames(outputFileObj.getvalue())
+    self.assertEqual([len(frame) for frame in frames], [3, 2])
+
+
+
+class ThroughputModeTestCase(unittest.TestCase):
+
+  def setUp(self):
+    tempDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tempDir)
+    self.inputPath = os.path.join(tempDir, "input.csv")
+
+    with open(self.inputPath, "wb") as fileObj:
+      fileObj.write("timestamp,value\r\n")
+      timestamp = datetime(2016, 1, 1)
+      for i in xrange(500):
+        value = "" if i % 50 == 7 else str(i % 37)
+        fileObj.write("%s,%s\r\n" % (
+          (timestamp + timedelta(minutes=i)).strftime("%Y-%m-%d %H:%M:%S"),
+          value))
+
+    self.inputSpec = dict(rowOffset=1,
+                          timestampIndex=0,
+                          valueIndex=1,
+                          datetimeFormat="%Y-%m-%d %H:%M:%S")
+    self.modelSpec = dict(modelId="test",
+                          modelConfig={},
+                          inferenceArgs={},
+                          timestampFieldName="c0",
+                          valueFieldName="c1")
+
+    model = Mock(spec_set=["run"])
+    model.run.return_value.inferences = {"anomalyScore": 0.5}
+    patcher = patch.object(model_runner_2._ModelRunner, "_createModel",
+                           autospec=True, return_value=model)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+    likelihood = Mock(spec_set=["anomalyProbability", "computeLogLikelihood"])
+    likelihood.anomalyProbability.side_effect = (
+      lambda value, anomalyScore, timestamp: value / 100.0)
+    likelihood.computeLogLikelihood.side_effect = (
+      lambda probability: probability)
+    patcher = patch.object(model_runner_2, "AnomalyLikelihood", autospec=True,
+                           return_value=likelihood)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+
+  def _runLineMode(self, aggSpec):
+    outputFileObj = StringIO()
+    with open(self.inputPath, "rU") as inputFileObj:
+      # pylint: disable=W0212
+      model_runner_2._ModelRunner(
+        inputFileObj=inputFileObj,
+        inputSpec=self.inputSpec,
+        aggSpec=aggSpec,
+        modelSpec=self.modelSpec,
+        resultWriter=model_runner_2._LineResultWriter(outputFileObj)).run()
+
+    return [json.loads(line) for line in outputFileObj.getvalue().splitlines()]
+
+
+  def _runThroughputMode(self, aggSpec):
+    outputFileObj = StringIO()
+    # pylint: disable=W0212
+    resultWriter = model_runner_2._FramedResultWriter(outputFileObj,
+                                                      maxRows=64,
+                                                      maxLatency=60)
+    with open(self.inputPath, "rb") as inputFileObj:
+      model_runner_2._ModelRunner(
+        inputFileObj=model_runner_2._ChunkedLineIterInputFile(
+          inputFileObj, chunkSize=1000, beforeRead=resultWriter.flush),
+        inputSpec=self.inputSpec,
+        aggSpec=aggSpec,
+        modelSpec=self.modelSpec,
+        resultWriter=resultWriter).run()
+
+    return _decodeFrames(outputFileObj.getvalue())
+
+
+  def testResultsMatchLineMode(self):
+    for aggSpec in (None, dict(windowSize=300, func="sum")):
+      expectedResults = self._runLineMode(aggSpec)
+      frames = self._runThroughputMode(aggSpec)
+
+      self.assertGreater(len(expectedResults), 50)
+      self.assertGreater(len(frames), 1)
+      self.assertLessEqual(max(len(frame) for frame in frames), 64)
+      self.assertEqual([result for frame in frames for result in frame],
+                       expectedResults)
+
+
+
+class ReplayCheckpointTestCase(unittest.TestCase):
+
+  def setUp(self):
+    tempDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tempDir)
+    self.checkpointDir = os.path.join(tempDir, "checkpoints")
+    self.inputPath = os.path.join(tempDir, "input.csv")
+
+    with open(self.inputPath, "wb") as fileObj:
+      fileObj.write("timestamp,value\n")
+      timestamp = datetime(2016, 1, 1)
+      for i in xrange(1200):
+        fileObj.write("%s,%s\n" % (
+          (timestamp + timedelta(minutes=5 * i)).strftime("%Y-%m-%d %H:%M:%S"),
+          "" if i % 100 == 3 else (i * 7) % 23 / 4.0))
+
+    self.inputSpec = dict(csv=self.inputPath,
+                          rowOffset=1,
+                          timestampIndex=0,
+                          valueIndex=1,
+                          datetimeFormat="%Y-%m-%d %H:%M:%S")
+    self.modelSpec = dict(modelId="test",
+                          modelConfig={},
+                          inferenceArgs={},
+                          timestampFieldName="c0",
+                          valueFieldName="c1")
+
+    patcher = patch.object(model_runner_2._ModelRunner, "_createModel",
+                           autospec=True,
+                           side_effect=lambda modelSpec: _StubModel())
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+    patcher = patch.object(model_runner_2, "ModelFactory", autospec=True)
+    modelFactoryMock = patcher.start()
+    modelFactoryMock.loadFromCheckpoint.side_effect = (
+      _StubModel.loadFromCheckpoint)
+    self.addCleanup(patcher.stop)
+
+
+  def _run(self, aggSpec, resultWriterFactory, checkpointStore=None,
+           resume=False, inputSpec=None):
+    """
+    :returns: the results emitted as lines
+    """
+    outputFileObj = StringIO()
+    try:
+      with open(self.inputPath, "rU") as inputFileObj:
+        # pylint: disable=W0212
+        model_runner_2._ModelRunner(
+          inputFileObj=inputFileObj,
+          inputSpec=inputSpec or self.inputSpec,
+          aggSpec=aggSpec,
+          modelSpec=self.modelSpec,
+          resultWriter=resultWriterFactory(outputFileObj),
+          checkpointStore=checkpointStore,
+          checkpointInterval=250,
+          resume=resume).run()
+    finally:
+      self.results = outputFileObj.getvalue().splitlines()
+
+    return self.results
+
+
+  def testResumedRunMatchesUninterruptedRun(self):
+    # pylint: disable=W0212
+    for aggSpec in (None, dict(windowSize=900, func="mean")):
+      shutil.rmtree(self.checkpointDir, ignore_errors=True)
+
+      expectedResults = self._run(aggSpec, model_runner_2._LineResultWriter)
+
+      # Interrupt a checkpointed run part of the way through the input
+      numInterruptedResults = len(expectedResults) * 2 // 3
+      with self.assertRaises(_InterruptedError):
+        self._run(
+          aggSpec,
+          lambda outputFileObj: _InterruptingResultWriter(
+            outputFileObj, numInterruptedResults),
+          checkpointStore=model_runner_2._ReplayCheckpointStore(
+            self.checkpointDir))
+      self.assertEqual(self.results,
+                       expectedResults[:numInterruptedResults])
+
+      checkpointStore = model_runner_2._ReplayCheckpointStore(
+        self.checkpointDir)
+      _, state = checkpointStore.load()
+      self.assertGreater(state["numResults"], 0)
+      self.assertLess(state["numResults"], numInterruptedResults)
+      self.assertEqual(state["numInputRows"] % 250, 0)
+
+      # The resumed run emits the results after those before the checkpoint
+      resumedResults = self._run(aggSpec, model_runner_2._LineResultWriter,
+                                 checkpointStore=checkpointStore,
+                                 resume=True)
+      self.assertEqual(resumedResults,
+                       expectedResults[state["numResults"]:])
+
+      # Only the latest checkpoint is kept
+      self.assertEqual(len(os.listdir(self.checkpointDir)), 1)
+
+
+  def testResumeWithoutCheckpointStartsFromBeginning(self):
+    # pylint: disable=W0212
+    expectedResults = self._run(None, model_runner_2._LineResultWriter)
+
+    results = self._run(
+      None,
+      model_runner_2._LineResultWriter,
+      checkpointStore=model_runner_2._ReplayCheckpointStore(
+        self.checkpointDir),
+      resume=True)
+
+    self.assertEqual(results, expectedResults)
+
+
+  def testResumeRejectsMismatchedCheckpoint(self):
+    # pylint: disable=W0212
+    checkpointStore = model_runner_2._ReplayCheckpointStore(self.checkpointDir)
+    self._run(None, model_runner_2._LineResultWriter,
+              checkpointStore=checkpointStore)
+
+    # Different input specification
+    inputSpec = dict(self.inputSpec, rowOffset=2)
+    with self.assertRaises(model_runner_2._ReplayCheckpointMismatch):
+      self._run(None, model_runner_2._LineResultWriter,
+                checkpointStore=checkpointStore, resume=True,
+                inputSpec=inputSpec)
+
+    # Input that changed before the checkpointed row
+    with open(self.inputPath, "rb") as fileObj:
+      lines = fileObj.readlines()
+    lines[600] = "2016-01-03 01:55:00,100.0\n"
+    with open(self.inputPath, "wb") as fileObj:
+      fileObj.writelines(lines)
+
+    with self.assertRaises(model_runner_2._ReplayCheckpointMismatch):
+      self._run(None, model_runner_2._LineResultWriter,
+                checkpointStore=checkpointStore, resume=True)
+
+
+  def testInterruptedSaveKeepsPreviousCheckpoint(self):
+    # pylint: disable=W0212
+    checkpointStore = model_runner_2._ReplayCheckpointStore(self.checkpointDir)
+    checkpointStore.save(model=_StubModel(), state={"numInputRows": 1})
+
+    model = _StubModel()
+    with patch.object(model, "save", autospec=True,
+                      side_effect=_InterruptedError):
+      with self.assertRaises(_InterruptedError):
+        checkpointStore.save(model=model, state={"numInputRows": 2})
+
+    # A new store cleans up the interrupted checkpoint
+    checkpointStore = model_runner_2._ReplayCheckpointStore(self.checkpointDir)
+    self.assertEqual(len(os.listdir(self.checkpointDir)), 1)
+    _, state = checkpointStore.load()
+    self.assertEqual(state, {"numInputRows": 1})
+
@@ -0,0 +1,298 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""Unit test of the unicorn_backend.model_runner_host module"""
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+import json
+from mock import Mock, patch
+from StringIO import StringIO
+import sys
+import unittest
+
+from unicorn_backend import model_runner_2
+from unicorn_backend import model_runner_host
+
+
+
+_StubModelResult = namedtuple("_StubModelResult", "inferences")
+
+
+
+class _StubModelError(Exception):
+  pass
+
+
+
+class _StubModel(object):
+  """ Deterministic stand-in for an OPF model that records the order in which
+  the models run; the model with ID "failing" fails on its 5th record
+  """
+
+  def __init__(self, modelId, runs):
+    self.modelId = modelId
+    self.runs = runs
+    self.total = 0.0
+
+
+  def run(self, inputRecord):
+    self.runs.append(self.modelId)
+    if self.modelId == "failing" and self.runs.count(self.modelId) == 5:
+      raise _StubModelError("Stub model failed")
+
+    self.total += inputRecord["c1"]
+    return _StubModelResult(inferences={"anomalyScore": self.total % 1.0})
+
+
+
+def _encodeFrames(messages):
+  # pylint: disable=W0212
+  return "".join(model_runner_2._FRAME_HEADER.pack(len(payload)) + payload
+                 for payload in (json.dumps(message) for message in messages))
+
+
+
+def _decodeFrames(data):
+  frames = []
+  inputFileObj = StringIO(data)
+  while True:
+    # pylint: disable=W0212
+    payload = model_runner_host._readFrame(inputFileObj)
+    if payload is None:
+      return frames
+
+    frames.append(json.loads(payload))
+
+
+
+def _createRows(numRows, seed):
+  timestamp = datetime(2016, 1, 1)
+  return [[(timestamp + timedelta(minutes=5 * i)).strftime("%Y-%m-%d %H:%M:%S"),
+           "" if i % 40 == 3 else str((i * seed) % 23 / 4.0)]
+          for i in xrange(numRows)]
+
+
+
+class ModelRunnerHostTestCase(unittest.TestCase):
+
+  def setUp(self):
+    self.inputSpec = dict(rowOffset=0,
+                          timestampIndex=0,
+                          valueIndex=1,
+                          datetimeFormat="%Y-%m-%d %H:%M:%S")
+    self.runs = []
+
+    patcher = patch.object(
+      model_runner_2._ModelRunner, "_createModel", autospec=True,
+      side_effect=lambda modelSpec: _StubModel(modelSpec["modelId"],
+                                               self.runs))
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+    likelihood = Mock(spec_set=["anomalyProbability", "computeLogLikelihood"])
+    likelihood.anomalyProbability.side_effect = (
+      lambda value, anomalyScore, timestamp: anomalyScore)
+    likelihood.computeLogLikelihood.side_effect = (
+      lambda probability: probability)
+    patcher = patch.object(model_runner_2, "AnomalyLikelihood", autospec=True,
+                           return_value=likelihood)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+
+  @staticmethod
+  def _createModelSpec(modelId):
+    return dict(modelId=modelId,
+                modelConfig={},
+                inferenceArgs={},
+                timestampFieldName="c0",
+                valueFieldName="c1")
+
+
+  def _defineModel(self, modelId, aggSpec=None, inputSpec=None):
+    return {"command": "defineModel",
+            "modelId": modelId,
+            "input": inputSpec or self.inputSpec,
+            "agg": aggSpec,
+            "model": self._createModelSpec(modelId)}
+
+
+  def _runSingleModel(self, modelId, aggSpec, rows):
+    """ Run a model as model_runner_2 would
+
+    :returns: the results
+    """
+    outputFileObj = StringIO()
+    inputFileObj = StringIO("".join("%s\n" % (",".join(row),) for row in rows))
+    # pylint: disable=W0212
+    model_runner_2._ModelRunner(
+      inputFileObj=inputFileObj,
+      inputSpec=self.inputSpec,
+      aggSpec=aggSpec,
+      modelSpec=self._createModelSpec(modelId),
+      resultWriter=model_runner_2._LineResultWriter(outputFileObj)).run()
+
+    return [json.loads(line) for line in outputFileObj.getvalue().splitlines()]
+
+
+  @staticmethod
+  def _runHost(messages, quantum=100):
+    """
+    :returns: the output frames
+    """
+    outputFileObj = StringIO()
+    # pylint: disable=W0212
+    model_runner_host._ModelHost(inputFileObj=StringIO(_encodeFrames(messages)),
+                                 outputFileObj=outputFileObj,
+                                 flushRows=50,
+                                 flushLatencyMs=60000,
+                                 quantum=quantum).run()
+
+    return _decodeFrames(outputFileObj.getvalue())
+
+
+  def testResultsMatchSingleModelRunners(self):
+    aggSpec = dict(windowSize=900, func="mean")
+    rowsA = _createRows(300, seed=7)
+    rowsB = _createRows(200, seed=11)
+
+    messages = [self._defineModel("a"), self._defineModel("b", aggSpec)]
+    for i in xrange(0, 300, 60):
+      messages.append({"command": "rows", "modelId": "a",
+                       "rows": rowsA[i:i + 60]})
+      messages.append({"command": "rows", "modelId": "b",
+                       "rows": rowsB[i:i + 60]})
+    messages.append({"command": "endInput", "modelId": "a"})
+
+    # The input of "b" is ended by the end of stdin
+    frames = self._runHost(messages)
+
+    for modelId, aggSpec, rows in (("a", None, rowsA), ("b", aggSpec, rowsB)):
+      modelFrames = [frame for frame in frames if frame["modelId"] == modelId]
+      self.assertEqual(modelFrames[-1], {"modelId": modelId, "end": True})
+      self.assertTrue(all(len(frame["results"]) <= 50
+                          for frame in modelFrames[:-1]))
+      self.assertEqual(
+        [result for frame in modelFrames[:-1] for result in frame["results"]],
+        self._runSingleModel(modelId, aggSpec, rows))
+
+
+  def testFailedModelsDontAffectOtherModels(self):
+    rows = _createRows(100, seed=7)
+
+    frames = self._runHost([
+      self._defineModel("failing"),
+      self._defineModel("good"),
+      self._defineModel("csv", inputSpec=dict(self.inputSpec, csv="/x.csv")),
+      {"command": "rows", "modelId": "failing", "rows": rows},
+      {"command": "rows", "modelId": "good", "rows": rows[:50]},
+      {"command": "rows", "modelId": "undefined", "rows": rows},
+      {"command": "rows", "modelId": "good", "rows": [["garbage", "1"]]},
+      self._defineModel("good2"),
+      {"command": "rows", "modelId": "good2", "rows": rows}
+    ])
+
+    errors = dict((frame["modelId"], frame["error"]["errorText"])
+                  for frame in frames if "error" in frame)
+    self.assertItemsEqual(errors.keys(),
+                          ["failing", "csv", "undefined", "good"])
+    self.assertEqual(errors["failing"], "Stub model failed")
+    self.assertIn("csv input is not supported", errors["csv"])
+    self.assertIn("not defined", errors["undefined"])
+
+    def _getResults(modelId):
+      return [result
+              for frame in frames if frame["modelId"] == modelId
+              for result in frame.get("results", [])]
+
+    # Results computed before a failure are emitted before the error
+    self.assertEqual(_getResults("failing"),
+                     self._runSingleModel("failing", None, rows[:5]))
+    self.assertEqual(_getResults("good"),
+                     self._runSingleModel("good", None, rows[:50]))
+    self.assertEqual(_getResults("good2"),
+                     self._runSingleModel("good2", None, rows))
+    self.assertIn({"modelId": "good2", "end": True}, frames)
+
+
+  def testModelsAreServedRoundRobin(self):
+    outputFileObj = StringIO()
+    # pylint: disable=W0212
+    host = model_runner_host._ModelHost(inputFileObj=None,
+                                        outputFileObj=outputFileObj,
+                                        flushRows=50,
+                                        flushLatencyMs=60000,
+                                        quantum=10)
+
+    rows = _createRows(30, seed=7)
+    for message in [self._defineModel("a"),
+                    self._defineModel("b"),
+                    self._defineModel("c"),
+                    {"command": "rows", "modelId": "a", "rows": rows},
+                    {"command": "rows", "modelId": "b", "rows": rows[:5]},
+                    {"command": "rows", "modelId": "c", "rows": rows[:20]},
+                    {"command": "rows", "modelId": "d", "rows": rows}]:
+      host._dispatch(json.dumps(message))
+
+    host._runRound()
+    host._dispatch(json.dumps({"command": "removeModel", "modelId": "c"}))
+    while host._readyModels:
+      host._runRound()
+
+    # Rows 3 of each model are missing values, which aren't run
+    self.assertEqual(self.runs,
+                     ["a"] * 9 + ["b"] * 4 + ["c"] * 9 +
+                     ["a"] * 10 +
+                     ["a"] * 10)
+    self.assertItemsEqual(host._models.keys(), ["a", "b"])
+    self.assertEqual(_decodeFrames(outputFileObj.getvalue())[0]["modelId"],
+                     "d")
+
+
+  def testMalformedInputIsFatal(self):
+    for data in (_encodeFrames([self._defineModel("a")])[:-1],
+                 _encodeFrames(["not a command"]),
+                 _encodeFrames([{"command": "unknown", "modelId": "a"}])):
+      # pylint: disable=W0212
+      host = model_runner_host._ModelHost(inputFileObj=StringIO(data),
+                                          outputFileObj=StringIO(),
+                                          flushRows=50,
+                                          flushLatencyMs=60000,
+                                          quantum=10)
+      with self.assertRaises(model_runner_host._ProtocolError):
+        host.run()
+
+
+  def testParseArgsRejectsInvalidOptions(self):
+    for args in (["--quantum", "0"],
+                 ["--flushRows", "0"],
+                 ["--flushLatencyMs", "-1"]):
+      with patch.object(sys, "argv",
+                        ["unicorn_backend/model_runner_host.py"] + args):
+        # pylint: disable=W0212
+        with self.assertRaises(model_runner_host._CommandLineArgError):
+          model_runner_host._parseArgs()
+
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -33,6 +33,8 @@ import tempfile
 import unittest
 from mock import patch
 
+import numpy
+
 from unicorn_backend import param_finder_runner
 
 
@@ -101,6 +103,89 @@ class ParamFinderRunnerTestCase(unittest.TestCase):
     self.assertEqual(str(timestamps[0]), "2014-04-01 00:00:00+00:00")
 
 
+  def testReadCSVColumnsMatchesReadCSVFile(self):
+    """
+    The columnar reader yields the same samples as _readCSVFile, whether
+    timestamps take the vectorized path or the flexible parser
+    """
+    baseTime = datetime.datetime(2016, 1, 1, 0, 0, 0)
+
+    formats = (
+      ("%Y-%m-%d %H:%M:%S", lambda ts: ts.strftime("%Y-%m-%d %H:%M:%S")),
+      ("%Y-%m-%dT%H:%M:%S.%f", lambda ts: ts.strftime("%Y-%m-%dT%H:%M:%S.%f")),
+      ("%m/%d/%y %H:%M", lambda ts: ts.strftime("%m/%d/%y %H:%M")),
+      ("%Y-%m-%d %H:%M:%S%z",
+       lambda ts: ts.strftime("%Y-%m-%d %H:%M:%S") + "-0500"),
+      ("#T", lambda ts: str((ts - datetime.datetime(1970, 1, 1))
+                            .total_seconds())),
+      ("#t", lambda ts: str((ts - datetime.datetime(1970, 1, 1))
+                            .total_seconds() * 1000)),
+    )
+
+    for datetimeFormat, formatTimestamp in formats:
+      csvFd, csvPath = tempfile.mkstemp()
+      self.addCleanup(os.unlink, csvPath)
+
+      with os.fdopen(csvFd, "wb") as csvFile:
+        csvWriter = csv.writer(csvFile)
+        csvWriter.writerow(["timeStamps", "values"])
+        for i in xrange(250):
+          timestamp = baseTime + datetime.timedelta(seconds=300 * i,
+                                                    microseconds=1500 * i)
+          value = "NaN" if i % 17 == 0 else 0.5 * i
+          csvWriter.writerow([formatTimestamp(timestamp), value])
+        # A row with a single column is skipped
+        csvWriter.writerow(["x"])
+        # A timestamp that doesn't fit the vectorized layout
+        csvWriter.writerow([formatTimestamp(baseTime).replace("2016", "2017"),
+                            1.0])
+
+      params = dict(fileName=csvPath,
+                    rowOffset=1,
+                    timestampIndex=0,
+                    valueIndex=1,
+                    datetimeFormat=datetimeFormat)
+
+      samples = param_finder_runner._readCSVFile(**params)
+      expectedTimestamps = numpy.array([timestamp for timestamp, _ in samples],
+                                       dtype="datetime64[ms]")
+      expectedValues = numpy.array([value for _, value in samples])
+
+      # Small chunks to cross chunk boundaries
+      with patch.object(param_finder_runner, "_CSV_CHUNK_NUM_ROWS", new=64):
+        timestamps, values = param_finder_runner._readCSVColumns(**params)
+
+        self.assertEqual(timestamps.dtype, numpy.dtype("datetime64[ms]"))
+        self.assertEqual(values.dtype, numpy.dtype("float64"))
+        self.assertTrue(numpy.array_equal(timestamps, expectedTimestamps),
+                        datetimeFormat)
+        self.assertTrue(numpy.array_equal(values, expectedValues),
+                        datetimeFormat)
+
+        # Limit on the number of samples
+        timestamps, values = param_finder_runner._readCSVColumns(
+          maxNumRows=100, **params)
+        self.assertTrue(numpy.array_equal(timestamps, expectedTimestamps[:100]))
+        self.assertTrue(numpy.array_equal(values, expectedValues[:100]))
+
+
+  def testReadCSVColumnsRejectsInvalidTimestamp(self):
+    csvFd, csvPath = tempfile.mkstemp()
+    self.addCleanup(os.unlink, csvPath)
+
+    with os.fdopen(csvFd, "wb") as csvFile:
+      csvWriter = csv.writer(csvFile)
+      csvWriter.writerow(["2014-04-01 00:00:00", 20.0])
+      csvWriter.writerow(["2014-04-01 25:00:00", 20.0])
+
+    with self.assertRaises(ValueError):
+      param_finder_runner._readCSVColumns(fileName=csvPath,
+                                          rowOffset=0,
+                                          timestampIndex=0,
+                                          valueIndex=1,
+                                          datetimeFormat="%Y-%m-%d %H:%M:%S")
+
+
   def testParamFinderRunner(self):
     """
     End-to-end test that calls param finder runner"s main with appropriate
@@ -99,6 +99,57 @@ class ParamFinderTestCase(unittest.TestCase):
     self.assertTrue(abs(targetPeriod - calculatedPeriodInS) / targetPeriod < .1)
 
 
+  def testNextFastFFTLength(self):
+    for size, expected in ((1, 1), (7, 8), (11, 12), (13, 15), (17, 18),
+                           (1000, 1000), (1001, 1024), (2 ** 20 + 1, 1049760)):
+      self.assertEqual(param_finder._nextFastFFTLength(size), expected)
+
+
+  def testCwtFFTMatchesDirectConvolution(self):
+    values = numpy.random.RandomState(42).randn(1000)
+    # Includes widths whose wavelet is truncated to the length of the data
+    widths = numpy.logspace(0, numpy.log10(300), 20)
+
+    direct = param_finder._cwt(values, param_finder._rickerWavelet, widths,
+                               useFFT=False)
+    fft = param_finder._cwt(values, param_finder._rickerWavelet, widths)
+
+    self.assertEqual(fft.shape, (20, 1000))
+    self.assertTrue(numpy.allclose(fft, direct, rtol=1e-9, atol=1e-9))
+
+
+  def testCoarseToFineContinuousWaveletTransform(self):
+    """
+    Coarse-to-fine analysis matches the full-resolution analysis within the
+    tolerance documented at COARSE_TO_FINE_MIN_WIDTH
+    """
+    samplingIntervalInMs = numpy.timedelta64(300 * 1000, 'ms')
+    numDataPts = 20000
+    rnd = numpy.random.RandomState(42)
+    timeInS = numpy.arange(numDataPts) * 300.0
+    values = (numpy.sin(2 * numpy.pi * timeInS / 86400.0) +
+              0.3 * rnd.randn(numDataPts))
+
+    (cwtVar, timeScaleInMs) = param_finder._calculateContinuousWaveletTransform(
+      samplingIntervalInMs, values)
+    (coarseCwtVar,
+     coarseTimeScaleInMs) = param_finder._calculateContinuousWaveletTransform(
+       samplingIntervalInMs, values, coarseToFine=True)
+
+    self.assertTrue(numpy.array_equal(coarseTimeScaleInMs, timeScaleInMs))
+    self.assertLess(numpy.max(numpy.abs(coarseCwtVar - cwtVar) / cwtVar), 0.05)
+
+    aggregationWindows = [
+      param_finder._determineAggregationWindow(
+        timeScale=timeScaleInMs,
+        cwtVar=var,
+        thresh=param_finder._AGGREGATION_WINDOW_THRESH,
+        samplingInterval=samplingIntervalInMs,
+        numDataPts=numDataPts)
+      for var in (cwtVar, coarseCwtVar)]
+    self.assertEqual(aggregationWindows[0], aggregationWindows[1])
+
+
   def testDetermineEncoderTypes(self):
     # daily and weekly periodicity in units of seconds
     dayPeriod = 86400.0
@@ -253,6 +304,27 @@ class ParamFinderTestCase(unittest.TestCase):
                       ["sensorParams"]["encoders"]["c0_dayOfWeek"])
 
 
+  def testFindParametersFromArrays(self):
+    timestamps = (numpy.datetime64("2016-01-01T00:00:00", "ms") +
+                  numpy.arange(50) * numpy.timedelta64(300, "s"))
+    values = numpy.arange(50, dtype="float64")
+
+    # Too few samples for the wavelet analysis; same defaults as findParameters
+    samples = zip(timestamps.astype(datetime.datetime), values)
+    self.assertEqual(param_finder.findParametersFromArrays(timestamps, values),
+                     param_finder.findParameters(samples))
+
+    with self.assertRaises(TypeError):
+      param_finder.findParametersFromArrays(timestamps.astype("datetime64[s]"),
+                                            values)
+
+    with self.assertRaises(ValueError):
+      param_finder.findParametersFromArrays(timestamps, values[:-1])
+
+    with self.assertRaises(ValueError):
+      param_finder.findParametersFromArrays(timestamps[:0], values[:0])
+
+
   def testGetModelParams(self):
     values = numpy.linspace(0, 10, 10)
     modelParams = param_finder._getModelParams(